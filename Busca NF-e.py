@@ -25,7 +25,7 @@ import subprocess
 import logging
 import argparse
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Callable
+from typing import Any, Dict, List, Optional, Callable, Tuple
 from datetime import datetime
 import sqlite3
 import ctypes
@@ -53,7 +53,7 @@ from PyQt5.QtWidgets import (
     QGroupBox, QRadioButton, QDateEdit, QStyle, QCheckBox, QTabWidget, QListWidget,
     QListWidgetItem
 )
-from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal, QSettings, QSize
+from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal, QSettings, QSize, QAbstractTableModel, QModelIndex
 from PyQt5.QtGui import QIcon, QColor, QBrush, QFont, QCloseEvent
 
 # Classe customizada para ordenação numérica
@@ -103,6 +103,85 @@ class CenterIconDelegate(QStyledItemDelegate):
     def initStyleOption(self, option, index):
         super().initStyleOption(option, index)
 
+# Modelo dos relatórios (modules/relatorios): linhas lidas do banco sob demanda
+class RelatorioTableModel(QAbstractTableModel):
+    """Mostra um Relatorio paginado; ordenar pelo cabeçalho refaz a consulta (ORDER BY no banco)."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._conn = None
+        self._relatorio = None
+        self._filtro = None
+        self._paginador = None
+        self._linhas = []
+
+    def carregar(self, conn, relatorio, filtro, ordem=None):
+        from modules.relatorios import Paginador
+        self.beginResetModel()
+        if self._paginador is not None:
+            self._paginador.fechar()
+        self._conn, self._relatorio, self._filtro = conn, relatorio, filtro
+        self._paginador = Paginador(conn, relatorio, filtro, ordem)
+        self._linhas = self._paginador.proximas()
+        self.endResetModel()
+
+    def limpar(self):
+        self.beginResetModel()
+        if self._paginador is not None:
+            self._paginador.fechar()
+        self._paginador = None
+        self._linhas = []
+        self.endResetModel()
+
+    @property
+    def relatorio(self):
+        return self._relatorio
+
+    def linha(self, row):
+        """Valores crus (centavos, data ISO) da linha."""
+        return self._linhas[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._linhas)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() or self._relatorio is None else len(self._relatorio.colunas)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        coluna = self._relatorio.colunas[index.column()]
+        valor = self._linhas[index.row()][index.column()]
+        if role == Qt.DisplayRole:
+            from modules.relatorios import formatar
+            return formatar(valor, coluna.formato)
+        if role == Qt.TextAlignmentRole and coluna.formato in ('moeda', 'inteiro'):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role == Qt.UserRole:
+            return valor
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal and self._relatorio is not None:
+            return self._relatorio.colunas[section].titulo
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._paginador is not None and not self._paginador.esgotado
+
+    def fetchMore(self, parent=QModelIndex()):
+        novas = self._paginador.proximas()
+        if novas:
+            self.beginInsertRows(QModelIndex(), len(self._linhas), len(self._linhas) + len(novas) - 1)
+            self._linhas.extend(novas)
+            self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if self._conn is None or self._relatorio is None:
+            return
+        # Ordem posicional vale para o relatório por nota e para o agrupado
+        direcao = "DESC" if order == Qt.DescendingOrder else "ASC"
+        self.carregar(self._conn, self._relatorio, self._filtro, f"{column + 1} {direcao}")
+
 def get_data_dir():
     """Retorna o diretório de dados do aplicativo (AppData para compilados, local para dev)."""
     import sys
@@ -145,6 +224,12 @@ LOGS_DIR = DATA_DIR / "logs"
 
 # Backend
 from modules.database import DatabaseManager as UIDB
+from modules.payload_codec import descompactar
+from modules.arquivo_mensal import (
+    caminho_existe, caminho_solto, extrair_temporario, is_caminho_arquivado,
+    ler_xml as ler_xml_arquivado,
+)
+from modules.colunas_normalizadas import formatar_centavos, iso_para_br
 from modules import sandbox_worker as sandbox
 
 
@@ -268,7 +353,32 @@ def run_search(progress_cb: Optional[Callable[[str], None]] = None) -> Dict[str,
         sys.stdout = old_stdout
 
 
-def resolve_xml_text(item: Dict[str, Any]) -> Optional[str]:
+def resolve_xml_text(item: Dict[str, Any], usar_cache: bool = True) -> Optional[str]:
+    """
+    XML completo da nota. Passa pelo cache compartilhado de documentos
+    (modules/documento_cache): ir e voltar entre PDF, eventos e detalhes da
+    mesma nota não reabre o banco nem relê o arquivo enquanto a origem não
+    muda. Processamentos em lote passam usar_cache=False para não expulsar
+    do cache as notas que o usuário está olhando.
+    """
+    chave = (item.get("chave") or "").strip()
+    if not chave:
+        return None
+    if not usar_cache:
+        resultado = _resolver_xml_origem(item)
+        return resultado[0] if resultado else None
+    try:
+        from modules.documento_cache import obter_cache_documentos
+        doc = obter_cache_documentos().documento(chave, lambda: _resolver_xml_origem(item))
+    except Exception as e:
+        print(f"[DEBUG XML] ⚠️ Cache de documentos indisponível: {e}")
+        resultado = _resolver_xml_origem(item)
+        return resultado[0] if resultado else None
+    return doc.texto if doc else None
+
+
+def _resolver_xml_origem(item: Dict[str, Any]) -> Optional[Tuple[str, Optional[str]]]:
+    """(texto, caminho de origem) do XML da nota; caminho None quando veio do banco."""
     try:
         chave = (item.get("chave") or "").strip()
         if not chave:
@@ -302,12 +412,12 @@ def resolve_xml_text(item: Dict[str, Any]) -> Optional[str]:
                 # Se tem xml_completo no banco, usa ele
                 if row[0]:
                     print(f"[DEBUG XML] ✅ XML encontrado no banco (xml_completo)")
-                    return row[0]
-                # Se não, tenta ler do arquivo
-                if row[1] and os.path.exists(row[1]):
+                    return descompactar(row[0]), None
+                # Se não, tenta ler do arquivo (solto ou dentro do ZIP mensal)
+                if row[1] and caminho_existe(row[1]):
                     try:
                         print(f"[DEBUG XML] ✅ XML encontrado no arquivo: {row[1]}")
-                        return Path(row[1]).read_text(encoding="utf-8", errors="ignore")
+                        return ler_xml_arquivado(row[1]), row[1]
                     except Exception as e:
                         print(f"[DEBUG XML] ⚠️ Erro ao ler arquivo: {e}")
             
@@ -315,10 +425,10 @@ def resolve_xml_text(item: Dict[str, Any]) -> Optional[str]:
             cam_row = conn.execute(
                 "SELECT caminho FROM xmls_caminhos WHERE chave = ? LIMIT 1", (chave,)
             ).fetchone()
-            if cam_row and cam_row[0] and os.path.exists(cam_row[0]):
+            if cam_row and cam_row[0] and caminho_existe(cam_row[0]):
                 try:
                     print(f"[DEBUG XML] ✅ XML encontrado via xmls_caminhos: {cam_row[0]}")
-                    return Path(cam_row[0]).read_text(encoding="utf-8", errors="ignore")
+                    return ler_xml_arquivado(cam_row[0]), cam_row[0]
                 except Exception as e:
                     print(f"[DEBUG XML] ⚠️ Erro ao ler via xmls_caminhos: {e}")
         
@@ -412,7 +522,7 @@ def resolve_xml_text(item: Dict[str, Any]) -> Optional[str]:
                                                     print(f"[DEBUG XML] ✅ NFS-e marcada como COMPLETO no banco")
                                             except Exception:
                                                 pass
-                                            return xml_content
+                                            return xml_content, str(f_path)
                                     except Exception:
                                         continue
 
@@ -456,7 +566,7 @@ def resolve_xml_text(item: Dict[str, Any]) -> Optional[str]:
                             except Exception as e_update:
                                 print(f"[DEBUG XML] ⚠️ Erro ao atualizar status: {e_update}")
                         
-                        return xml_content
+                        return xml_content, str(f)
                     except Exception:
                         continue
         
@@ -1021,6 +1131,13 @@ class MainWindow(QMainWindow):
         self.table.customContextMenuRequested.connect(self._on_table_context_menu)
         # Use o sinal específico da tabela com linha/coluna
         self.table.cellDoubleClicked.connect(self._on_table_double_clicked)
+        # PDFs das linhas visíveis pré-gerados em segundo plano (modules/pdf_especulativo);
+        # a rolagem só reagenda — a fila é montada quando ela para
+        self._prerender_timer = QTimer(self)
+        self._prerender_timer.setSingleShot(True)
+        self._prerender_timer.setInterval(400)
+        self._prerender_timer.timeout.connect(self._prerenderizar_visiveis)
+        self.table.verticalScrollBar().valueChanged.connect(lambda _: self._prerender_timer.start())
         
         # Tooltip instantâneo (100ms de delay)
         QApplication.instance().setStyleSheet(QApplication.instance().styleSheet() + 
@@ -1207,6 +1324,12 @@ class MainWindow(QMainWindow):
 
         # Data cache
         self.notes = []
+        # Feed de alterações (notas_detalhadas.alteracao_seq): último número já
+        # mesclado em self.notes e linha da grade de cada chave
+        self._notes_seq = 0
+        self._notes_idx = {}
+        self._linhas_por_chave = {}
+        self._delta_agendado = False
         
         # 🔄 Configura callback para atualizar interface quando uma nota é salva
         self.db._callback_nova_nota = self._on_nova_nota_callback
@@ -1253,6 +1376,8 @@ class MainWindow(QMainWindow):
         QTimer.singleShot(500, self._gerar_pdfs_faltantes)
         # Verifica se há sincronização pendente
         QTimer.singleShot(1500, self._verificar_sync_pendente)
+        # Índices de eventos e de documentos relacionados: varredura única do que já está em disco
+        QTimer.singleShot(5000, self._iniciar_indice_eventos)
         # ⛔ DESABILITADO: Consulta automática de status ao iniciar
         # A consulta de eventos só deve ocorrer:
         # 1. Após busca na SEFAZ (distribuição DFe)
@@ -1287,18 +1412,22 @@ class MainWindow(QMainWindow):
             
             def run(self):
                 try:
+                    import time
+                    from modules.pdf_lote import TrabalhoPDF, detectar_tipo, renderizar_lote, resumir
+
                     xmls_dir = DATA_DIR / "xmls"
                     if not xmls_dir.exists():
                         self.finished_signal.emit(0)
                         return
                     
                     print("[VERIFICAÇÃO] Procurando XMLs sem PDF...")
-                    count = 0
+                    trabalhos = []
                     for xml_file in xmls_dir.rglob("*.xml"):
                         # Verifica se thread deve parar
                         if self.isInterruptionRequested():
                             print("[INFO] Geração de PDFs interrompida")
-                            break
+                            self.finished_signal.emit(0)
+                            return
                         
                         # ⛔ PULA EVENTOS - Eventos NUNCA devem gerar PDF!
                         # Verifica pelo caminho (pasta "Eventos") OU pelo nome do arquivo
@@ -1311,82 +1440,66 @@ class MainWindow(QMainWindow):
                             continue
                         
                         pdf_file = xml_file.with_suffix('.pdf')
-                        if not pdf_file.exists():
-                            # Verifica novamente antes de processar
-                            if self.isInterruptionRequested():
-                                print("[INFO] Geração de PDFs interrompida")
-                                break
-                            
-                            try:
-                                xml_text = xml_file.read_text(encoding='utf-8')
-
-                                # ⛔ APENAS DOCUMENTOS COMPLETOS: Pula eventos, resumos, etc
-                                # NF-e/CT-e completas usam nfeProc/cteProc. NFS-e usa estrutura
-                                # própria (SPED/ADN ou ABRASF) e NUNCA tem essas tags — por isso
-                                # NFS-e ficava 100% fora desta rede de segurança antes desta correção.
-                                is_nfe_cte_completo = '<nfeProc' in xml_text or '<cteProc' in xml_text
-                                is_nfse_completo = (
-                                    'sped.fazenda.gov.br/nfse' in xml_text or
-                                    'abrasf.org.br' in xml_text or
-                                    'ListaNotaFiscal' in xml_text
-                                )
-                                if not is_nfe_cte_completo and not is_nfse_completo:
-                                    continue
-
-                                # Verifica mais uma vez antes de gerar PDF (operação lenta)
-                                if self.isInterruptionRequested():
-                                    print("[INFO] Geração de PDFs interrompida")
-                                    break
-
-                                # Detecta tipo do documento (NFe/CTe/NFS-e/NFC-e)
-                                if '<cteProc' in xml_text:
-                                    tipo = "CTe"
-                                elif is_nfse_completo:
-                                    tipo = "NFS-e"
-                                elif '<mod>65</mod>' in xml_text:
-                                    tipo = "NFCe"
-                                else:
-                                    tipo = "NFe"
+                        if pdf_file.exists():
+                            continue
+                        try:
+                            # ⛔ APENAS DOCUMENTOS COMPLETOS: Pula eventos, resumos, etc
+                            # NF-e/CT-e completas usam nfeProc/cteProc. NFS-e usa estrutura
+                            # própria (SPED/ADN ou ABRASF) e NUNCA tem essas tags — por isso
+                            # NFS-e ficava 100% fora desta rede de segurança antes desta correção.
+                            tipo = detectar_tipo(xml_file.read_text(encoding='utf-8'))
+                        except Exception as e:
+                            print(f"[ERRO PDF] {xml_file.name}: {e}")
+                            continue
+                        if tipo:
+                            trabalhos.append(TrabalhoPDF(str(xml_file), str(pdf_file), tipo))
 
-                                from modules.pdf_simple import generate_danfe_pdf
-                                result_pdf = generate_danfe_pdf(xml_text, str(pdf_file), tipo, xml_source_path=str(xml_file))
-                                success = result_pdf.get("ok") if isinstance(result_pdf, dict) else bool(result_pdf)
-                                if success:
-                                    count += 1
-                                    print(f"[PDF GERADO] {pdf_file.name}")
+                    if not trabalhos:
+                        print("[INFO] Todos os XMLs já possuem PDFs")
+                        self.finished_signal.emit(0)
+                        return
 
-                                    # 📝 Registra pdf_path/pdf_tipo no banco — sem isso, o PDF
-                                    # gerado aqui não é encontrado pelo cache (notas_detalhadas)
-                                    try:
-                                        from modules.xml_indexer import parse_nfe, parse_cte, parse_nfse, parse_nfse_abrasf, parse_nfce
-                                        chave_doc = None
-                                        if tipo == "CTe":
-                                            chave_doc = parse_cte(str(xml_file)).get("chave")
-                                        elif tipo == "NFS-e":
-                                            if 'abrasf.org.br' in xml_text or 'ListaNotaFiscal' in xml_text:
-                                                _r = parse_nfse_abrasf(str(xml_file))
-                                                chave_doc = _r[0].get("chave") if _r else None
-                                            else:
-                                                chave_doc = parse_nfse(str(xml_file)).get("chave")
-                                        elif tipo == "NFCe":
-                                            chave_doc = parse_nfce(str(xml_file)).get("chave")
-                                        else:
-                                            chave_doc = parse_nfe(str(xml_file)).get("chave")
+                    # Lote em pool de processos (modules/pdf_lote): geradores aquecidos,
+                    # escrita atômica e tempo por documento
+                    print(f"[PDF] {len(trabalhos)} XML(s) sem PDF — gerando em lote...")
+                    inicio = time.perf_counter()
+                    resultados = []
+                    for resultado in renderizar_lote(trabalhos, cancelado=self.isInterruptionRequested):
+                        resultados.append(resultado)
+                        trabalho = resultado.trabalho
+                        if not resultado.ok:
+                            print(f"[ERRO PDF] {Path(trabalho.xml_path).name}: {resultado.erro}")
+                            continue
+                        print(f"[PDF GERADO] {Path(trabalho.out_path).name} ({resultado.segundos:.2f}s)")
 
-                                        if chave_doc:
-                                            pdf_tipo_doc = result_pdf.get("pdf_tipo") if isinstance(result_pdf, dict) else None
-                                            _db_ref.atualizar_pdf_path(chave_doc, str(pdf_file.resolve()), pdf_tipo_doc)
-                                    except Exception as e_reg:
-                                        print(f"[AVISO] Erro ao registrar pdf_path no banco para {pdf_file.name}: {e_reg}")
-                            except Exception as e:
-                                print(f"[ERRO PDF] {xml_file.name}: {e}")
-                    
-                    if count > 0:
-                        print(f"[CONCLUÍDO] {count} PDFs gerados")
-                    else:
-                        print("[INFO] Todos os XMLs já possuem PDFs")
-                    
-                    self.finished_signal.emit(count)
+                        # 📝 Registra pdf_path/pdf_tipo no banco — sem isso, o PDF
+                        # gerado aqui não é encontrado pelo cache (notas_detalhadas)
+                        try:
+                            from modules.xml_indexer import parse_nfe, parse_cte, parse_nfse, parse_nfse_abrasf, parse_nfce
+                            xml_path = trabalho.xml_path
+                            chave_doc = None
+                            if trabalho.tipo == "CTe":
+                                chave_doc = parse_cte(xml_path).get("chave")
+                            elif trabalho.tipo == "NFS-e":
+                                _r = parse_nfse_abrasf(xml_path)
+                                chave_doc = _r[0].get("chave") if _r else parse_nfse(xml_path).get("chave")
+                            elif trabalho.tipo == "NFCe":
+                                chave_doc = parse_nfce(xml_path).get("chave")
+                            else:
+                                chave_doc = parse_nfe(xml_path).get("chave")
+
+                            if chave_doc:
+                                _db_ref.atualizar_pdf_path(chave_doc, str(Path(trabalho.out_path).resolve()),
+                                                           resultado.pdf_tipo)
+                        except Exception as e_reg:
+                            print(f"[AVISO] Erro ao registrar pdf_path no banco para {Path(trabalho.out_path).name}: {e_reg}")
+
+                    stats = resumir(resultados, time.perf_counter() - inicio)
+                    if self.isInterruptionRequested():
+                        print("[INFO] Geração de PDFs interrompida")
+                    print(f"[CONCLUÍDO] {stats['gerados']} PDFs gerados, {stats['falhas']} falha(s) — "
+                          f"{stats['por_minuto']}/min, média {stats['media_s']}s, máx {stats['max_s']}s por documento")
+                    self.finished_signal.emit(stats['gerados'])
                 except Exception as e:
                     print(f"[ERRO] Falha ao gerar PDFs: {e}")
                     self.finished_signal.emit(0)
@@ -1484,6 +1597,113 @@ class MainWindow(QMainWindow):
         except Exception as e:
             print(f"[ERRO] Erro ao atualizar certificados: {e}")
     
+    def _iniciar_indice_eventos(self):
+        """Indexa uma única vez os eventos, os vínculos e (se ligados) os itens já salvos (índices do banco)."""
+        from modules import doc_links, eventos_index, nfe_itens
+
+        self._iniciar_indexacao_unica(
+            'indice_eventos', 'Indexação de Eventos', eventos_index,
+            lambda: eventos_index.IndexadorEventos(self.db.db_path, DATA_DIR / "xmls"),
+            lambda stats: f"📋 {stats['eventos']} evento(s) | ⚠️ Ilegíveis: {stats['ilegiveis']}",
+            lambda stats: f"📋 Eventos indexados: {stats['eventos']} em {stats['arquivos']} arquivo(s)",
+            recarregar=lambda stats: stats['status_alterados'] > 0,
+        )
+        self._iniciar_indexacao_unica(
+            'indice_vinculos', 'Indexação de Documentos Relacionados', doc_links,
+            lambda: doc_links.IndexadorVinculos(self.db.db_path),
+            lambda stats: f"🔗 {stats['vinculos']} vínculo(s) | ⚠️ Sem XML: {stats['sem_xml']}",
+            lambda stats: f"🔗 Documentos relacionados indexados: {stats['vinculos']} vínculo(s)",
+        )
+        with self.db._connect() as conn:
+            itens_ativos = nfe_itens.ativo(conn)
+        if itens_ativos:
+            self._iniciar_indice_itens()
+
+    def _iniciar_indice_itens(self):
+        """Varredura única (retomável) que grava os itens das NF-e já salvas em nfe_itens."""
+        from modules import nfe_itens
+
+        self._iniciar_indexacao_unica(
+            'indice_itens', 'Indexação de Itens das NF-e', nfe_itens,
+            lambda: nfe_itens.IndexadorItens(self.db.db_path, pasta_xmls=DATA_DIR / "xmls"),
+            lambda stats: f"📦 {stats['itens']} item(ns) | ⚠️ Sem XML: {stats['nao_encontradas']}",
+            lambda stats: f"📦 Itens indexados: {stats['itens']} de {stats['notas']} nota(s)",
+        )
+
+    def _iniciar_indexacao_unica(self, tipo, nome, modulo, criar_job, mensagem, mensagem_fim, recarregar=None):
+        """Roda `criar_job()` no Gerenciador de Trabalhos se modulo.backfill_concluido ainda não marcou."""
+        try:
+            if any(t.get('tipo') == tipo for t in self._trabalhos_ativos):
+                return
+            with self.db._connect() as conn:
+                if modulo.backfill_concluido(conn):
+                    return
+
+            job = criar_job()
+
+            class IndexacaoWorker(QThread):
+                progress = pyqtSignal(int, int, dict)
+                concluido = pyqtSignal(dict)
+                error = pyqtSignal(str)
+
+                def pausar(self):
+                    job.pausar()
+
+                def retomar(self):
+                    job.retomar()
+
+                def cancelar(self):
+                    job.cancelar()
+
+                def run(self):
+                    try:
+                        self.concluido.emit(job.executar(progresso=self.progress.emit))
+                    except Exception as e:
+                        import traceback
+                        traceback.print_exc()
+                        self.error.emit(str(e))
+
+            worker = IndexacaoWorker(self)
+            trabalho = {
+                'tipo': tipo,
+                'nome': nome,
+                'status': 'Em execução',
+                'progresso': 0,
+                'total': 0,
+                'mensagem': 'Listando arquivos...',
+                'worker': worker
+            }
+            self._trabalhos_ativos.append(trabalho)
+
+            def on_progress(feitos, total, stats):
+                trabalho['progresso'] = feitos
+                trabalho['total'] = total
+                trabalho['mensagem'] = mensagem(stats)
+
+            def remover_trabalho():
+                self._trabalhos_ativos = [t for t in self._trabalhos_ativos if t is not trabalho]
+
+            def on_concluido(stats):
+                remover_trabalho()
+                if stats['cancelado']:
+                    self.set_status(f"⏹️ {nome} interrompida — será refeita na próxima abertura", 8000)
+                    return
+                self.set_status(mensagem_fim(stats), 8000)
+                if recarregar and recarregar(stats):
+                    self.refresh_all()
+
+            def on_error(msg):
+                remover_trabalho()
+                print(f"[INDEXAÇÃO] Erro em '{nome}': {msg}")
+
+            worker.progress.connect(on_progress)
+            worker.concluido.connect(on_concluido)
+            worker.error.connect(on_error)
+            worker.finished.connect(worker.deleteLater)
+            worker.start()
+        except Exception as e:
+            print(f"[INDEXAÇÃO] Não foi possível iniciar '{nome}': {e}")
+
     def _verificar_sync_pendente(self):
         """Verifica se há sincronização pendente e pergunta se quer retomar."""
         try:
@@ -1550,17 +1770,11 @@ class MainWindow(QMainWindow):
                 print("[AUTO-UPDATE] Nenhum certificado configurado")
                 return
             
-            # Obtém lista de chaves (apenas notas com status "Autorizado" para otimizar)
-            chaves = []
-            for nota in self.notes:
-                status = (nota.get('status') or '').lower()  # CORRIGIDO: era 'status_nota'
-                chave = nota.get('chave')
-                # Consulta apenas notas "autorizadas" (não consulta já canceladas)
-                if chave and len(chave) == 44 and 'autoriza' in status:
-                    chaves.append(chave)
+            # Obtém apenas as chaves cuja verificação venceu (agenda por idade/prazo de eventos)
+            chaves = self.db.chaves_status_devidas()
             
             if not chaves:
-                print("[AUTO-UPDATE] Nenhuma nota autorizada para atualizar")
+                print("[AUTO-UPDATE] Nenhuma nota com verificação pendente")
                 return
             
             print(f"[AUTO-UPDATE] {len(chaves)} notas serão verificadas")
@@ -1606,15 +1820,18 @@ class MainWindow(QMainWindow):
                 # NOTA: _auto_update_worker será limpo em _cleanup_auto_update_worker
                 # (conectado ao QThread.finished nativo, que dispara após run() terminar)
                 
-                # FORÇA recarregar dados do banco antes de atualizar tabela
+                # Corrige xml_status baseado em arquivos existentes
+                self._corrigir_xml_status_automatico()
+                
+                # Mescla só as notas alteradas (status/xml_status) desde a última carga
+                if self._sincronizar_alteracoes():
+                    print("[AUTO-UPDATE] Alterações mescladas na tabela")
+                    return
                 print("[AUTO-UPDATE] Recarregando dados do banco...")
                 old_count = len(self.notes)
                 self.notes = self.db.load_notes(limit=5000)  # Aumenta limite para 5000
                 print(f"[AUTO-UPDATE] {len(self.notes)} notas carregadas (antes: {old_count})")
                 
-                # Corrige xml_status baseado em arquivos existentes
-                self._corrigir_xml_status_automatico()
-                
                 # Verifica quantas estão canceladas
                 canceladas_count = sum(1 for n in self.notes if 'cancel' in (n.get('status') or '').lower())
                 print(f"[AUTO-UPDATE] {canceladas_count} notas canceladas detectadas nos dados")
@@ -1664,29 +1881,10 @@ class MainWindow(QMainWindow):
                 print("[PÓS-BUSCA] Nenhum certificado configurado")
                 return
             
-            # Obtém apenas documentos dos ÚLTIMOS 7 DIAS (otimização)
-            from datetime import datetime, timedelta
-            data_limite = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
-            
-            chaves_nfe = []
-            chaves_cte = []
-            
-            for nota in self.notes:
-                status = (nota.get('status') or '').lower()
-                chave = nota.get('chave')
-                data_emissao = (nota.get('data_emissao') or '')[:10]
-                tipo = (nota.get('tipo') or '').upper()
-                
-                # Consulta apenas documentos RECENTES e AUTORIZADOS
-                if (chave and len(chave) == 44 and 
-                    'autoriza' in status and 
-                    data_emissao >= data_limite):
-                    
-                    # Separa por tipo
-                    if tipo == 'CTE':
-                        chaves_cte.append(chave)
-                    else:
-                        chaves_nfe.append(chave)
+            # Obtém apenas documentos com verificação vencida na agenda — os recém-baixados
+            # (nunca consultados) vêm primeiro
+            chaves_nfe = self.db.chaves_status_devidas(limite=300, modelos=('55', '65'))
+            chaves_cte = self.db.chaves_status_devidas(limite=300, modelos=('57',))
             
             total_docs = len(chaves_nfe) + len(chaves_cte)
             
@@ -1694,7 +1892,7 @@ class MainWindow(QMainWindow):
                 print("[PÓS-BUSCA] Nenhum documento recente para atualizar")
                 return
             
-            print(f"[PÓS-BUSCA] {len(chaves_nfe)} NF-es e {len(chaves_cte)} CT-es recentes serão verificados")
+            print(f"[PÓS-BUSCA] {len(chaves_nfe)} NF-es e {len(chaves_cte)} CT-es com verificação pendente")
             self.set_status(f"🔄 Verificando eventos de {total_docs} documentos recentes (NF-e: {len(chaves_nfe)}, CT-e: {len(chaves_cte)})...")
             
             # Executa em thread
@@ -1959,7 +2157,7 @@ class MainWindow(QMainWindow):
                                         row_xb = cursor.fetchone()
                                         if row_xb:
                                             caminho_xb, xml_completo_xb = row_xb
-                                            if caminho_xb and Path(caminho_xb).exists():
+                                            if caminho_xb and caminho_existe(caminho_xb):
                                                 arquivo_existe = True
                                             elif xml_completo_xb:
                                                 arquivo_existe = True
@@ -2306,6 +2504,13 @@ class MainWindow(QMainWindow):
                         worker.wait(500)
             self._pdf_workers.clear()
 
+        # Para a pré-geração especulativa de PDFs (processo ocioso)
+        try:
+            from modules.pdf_especulativo import obter_prerenderizador
+            obter_prerenderizador(self.db).encerrar()
+        except Exception:
+            pass
+
         # Finaliza thread de geração de PDFs em background
         if hasattr(self, '_pdf_generator_worker') and self._pdf_generator_worker and self._pdf_generator_worker.isRunning():
             print(f"[DEBUG] Aguardando finalização de thread de geração de PDFs...")
@@ -2435,6 +2640,7 @@ class MainWindow(QMainWindow):
         add_action(tarefas, "💾 Armazenamento…", self.open_storage_config, "Ctrl+Shift+A", qstyle_icon=QStyle.SP_DriveFDIcon)
         add_action(tarefas, "🔄 Resetar Ordem das Colunas", self._resetar_ordem_colunas, None, qstyle_icon=QStyle.SP_BrowserReload)
         add_action(tarefas, "💰 Atualizar IBS/CBS das Notas", self._atualizar_ibs_cbs_notas, "Ctrl+Shift+U", qstyle_icon=QStyle.SP_FileDialogInfoView)
+        add_action(tarefas, "📦 Indexar Itens das NF-e", self._indexar_itens_nfe, None, qstyle_icon=QStyle.SP_FileDialogListView)
         tarefas.addSeparator()
         
         # Submenu: Intervalo de Busca Automática
@@ -2979,183 +3185,174 @@ class MainWindow(QMainWindow):
             print(f"❌ Erro ao salvar ordem de colunas: {e}")
     
     def _atualizar_ibs_cbs_notas(self):
-        """Atualiza IBS e CBS de todas as notas NFe existentes no banco"""
+        """Preenche IBS/CBS das NF-e antigas em segundo plano (modules/backfill_ibs_cbs)."""
         try:
-            from lxml import etree
-            
-            # Confirmação do usuário
-            reply = QMessageBox.question(
-                self,
-                "Atualizar IBS/CBS",
-                "Esta operação irá atualizar os valores de IBS e CBS de todas as notas NFe "
-                "existentes no banco de dados, extraindo os valores dos XMLs salvos.\n\n"
-                "Deseja continuar?",
-                QMessageBox.Yes | QMessageBox.No,
-                QMessageBox.No
-            )
-            
-            if reply != QMessageBox.Yes:
+            from modules.backfill_ibs_cbs import BackfillIBSCBS, contar_pendentes, ler_checkpoint
+
+            if any(t.get('tipo') == 'backfill_ibs_cbs' for t in self._trabalhos_ativos):
+                QMessageBox.information(self, "Atualizar IBS/CBS",
+                                        "A atualização de IBS/CBS já está em andamento.\n\n"
+                                        "Acompanhe no Gerenciador de Trabalhos (Ctrl+Shift+G).")
                 return
-            
-            # Busca notas sem IBS/CBS
+
             with self.db._connect() as conn:
-                cursor = conn.execute("""
-                    SELECT chave, tipo
-                    FROM notas_detalhadas
-                    WHERE (v_ibs IS NULL OR v_ibs = '' OR v_ibs = '0' OR v_ibs = '0.00')
-                      AND (v_cbs IS NULL OR v_cbs = '' OR v_cbs = '0' OR v_cbs = '0.00')
-                      AND tipo = 'NFe'
-                """)
-                notas = cursor.fetchall()
-            
-            total = len(notas)
-            
-            if total == 0:
+                checkpoint = ler_checkpoint(conn)
+                pendentes = contar_pendentes(conn)
+                restantes = contar_pendentes(conn, checkpoint) if checkpoint else pendentes
+
+            if pendentes == 0:
                 QMessageBox.information(
                     self,
                     "IBS/CBS Atualizado",
                     "Todas as notas NFe já possuem IBS/CBS atualizados!"
                 )
                 return
-            
-            # Progress dialog
-            progress = QProgressDialog(
-                f"Atualizando IBS/CBS de {total} notas...",
-                "Cancelar",
-                0,
-                total,
-                self
-            )
-            progress.setWindowTitle("Atualizando IBS/CBS")
-            progress.setWindowModality(Qt.WindowModal)
-            progress.show()
-            
-            atualizadas = 0
-            nao_encontradas = 0
-            sem_valores = 0
-            
-            # Namespaces para XML
-            ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-            
-            for idx, (chave, tipo) in enumerate(notas):
-                if progress.wasCanceled():
-                    break
-                
-                progress.setValue(idx)
-                progress.setLabelText(
-                    f"Processando nota {idx+1}/{total}...\n"
-                    f"✅ Atualizadas: {atualizadas} | ⚠️ XML não encontrado: {nao_encontradas} | ℹ️ Sem valores: {sem_valores}"
+
+            recomecar = False
+            if checkpoint and restantes:
+                reply = QMessageBox.question(
+                    self,
+                    "Atualizar IBS/CBS",
+                    f"Há uma atualização de IBS/CBS interrompida ({restantes} de {pendentes} nota(s) "
+                    f"ainda não verificadas).\n\n"
+                    f"Deseja continuar de onde parou?\n"
+                    f"(Se escolher 'Não', todas as {pendentes} nota(s) serão verificadas novamente)",
+                    QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel,
+                    QMessageBox.Yes
                 )
-                QApplication.processEvents()
-                
-                try:
-                    # Busca XML no banco primeiro
-                    xml_path = None
-                    with self.db._connect() as conn:
-                        cursor = conn.execute(
-                            "SELECT caminho_arquivo FROM xmls_baixados WHERE chave = ?",
-                            (chave,)
-                        )
-                        row = cursor.fetchone()
-                        if row and row[0]:
-                            xml_path = Path(row[0])
-                            if not xml_path.exists():
-                                xml_path = None
-                    
-                    # Se não encontrou no banco, busca nos diretórios
-                    if not xml_path:
-                        # Busca recursiva em xmls/
-                        xmls_dir = Path(self.BASE_DIR) / 'xmls'
-                        if xmls_dir.exists():
-                            matches = list(xmls_dir.rglob(f"*{chave}*.xml"))
-                            if matches:
-                                xml_path = matches[0]
-                    
-                    if not xml_path or not xml_path.exists():
-                        nao_encontradas += 1
-                        continue
-                    
-                    # Extrai IBS e CBS do XML
-                    with open(xml_path, 'r', encoding='utf-8') as f:
-                        xml_content = f.read()
-                    
-                    tree = etree.fromstring(xml_content.encode('utf-8'))
-                    
-                    v_ibs = ''
-                    v_cbs = ''
-                    
-                    # Tenta extrair do grupo IBSCBSTot
-                    ibs_cbs_tot = tree.find('.//{http://www.portalfiscal.inf.br/nfe}IBSCBSTot')
-                    if ibs_cbs_tot is not None:
-                        g_ibs = ibs_cbs_tot.find('{http://www.portalfiscal.inf.br/nfe}gIBS')
-                        if g_ibs is not None:
-                            v_ibs = g_ibs.findtext('{http://www.portalfiscal.inf.br/nfe}vIBS') or ''
-                        g_cbs = ibs_cbs_tot.find('{http://www.portalfiscal.inf.br/nfe}gCBS')
-                        if g_cbs is not None:
-                            v_cbs = g_cbs.findtext('{http://www.portalfiscal.inf.br/nfe}vCBS') or ''
-                    
-                    # Se não encontrou, tenta buscar direto no ICMSTot
-                    if not v_ibs:
-                        ibs_tags = tree.xpath('.//nfe:ICMSTot/nfe:vIBS', namespaces=ns)
-                        if ibs_tags and ibs_tags[0].text:
-                            v_ibs = ibs_tags[0].text
-                    
-                    if not v_cbs:
-                        cbs_tags = tree.xpath('.//nfe:ICMSTot/nfe:vCBS', namespaces=ns)
-                        if cbs_tags and cbs_tags[0].text:
-                            v_cbs = cbs_tags[0].text
-                    
-                    # Busca sem namespace (fallback)
-                    if not v_ibs:
-                        ibs_no_ns = tree.xpath(".//*[local-name()='vIBS']")
-                        if ibs_no_ns and ibs_no_ns[0].text:
-                            v_ibs = ibs_no_ns[0].text
-                    
-                    if not v_cbs:
-                        cbs_no_ns = tree.xpath(".//*[local-name()='vCBS']")
-                        if cbs_no_ns and cbs_no_ns[0].text:
-                            v_cbs = cbs_no_ns[0].text
-                    
-                    if v_ibs or v_cbs:
-                        # Atualiza no banco
-                        with self.db._connect() as conn:
-                            conn.execute("""
-                                UPDATE notas_detalhadas 
-                                SET v_ibs = ?, v_cbs = ?
-                                WHERE chave = ?
-                            """, (v_ibs or '0', v_cbs or '0', chave))
-                            conn.commit()
-                        atualizadas += 1
-                    else:
-                        sem_valores += 1
-                
-                except Exception as e:
-                    print(f"Erro ao processar nota {chave}: {e}")
-                    nao_encontradas += 1
-            
-            progress.setValue(total)
-            
-            # Mostra resultado
-            mensagem = (
-                f"Atualização de IBS/CBS concluída!\n\n"
-                f"✅ Notas atualizadas: {atualizadas}\n"
-                f"⚠️ XMLs não encontrados: {nao_encontradas}\n"
-                f"ℹ️ Notas sem valores IBS/CBS: {sem_valores}\n"
-                f"📋 Total processado: {total}"
-            )
-            
-            QMessageBox.information(self, "Atualização Concluída", mensagem)
-            
-            # Atualiza a interface se houve alterações
-            if atualizadas > 0:
-                print(f"✅ {atualizadas} notas foram atualizadas com IBS/CBS")
-                self.refresh_all()
-            
+                if reply == QMessageBox.Cancel:
+                    return
+                recomecar = reply == QMessageBox.No
+            else:
+                reply = QMessageBox.question(
+                    self,
+                    "Atualizar IBS/CBS",
+                    f"Esta operação irá atualizar os valores de IBS e CBS de {pendentes} nota(s) NFe "
+                    f"existentes no banco de dados, extraindo os valores dos XMLs salvos.\n\n"
+                    f"Ela roda em segundo plano e pode ser acompanhada, pausada ou cancelada "
+                    f"no Gerenciador de Trabalhos.\n\n"
+                    f"Deseja continuar?",
+                    QMessageBox.Yes | QMessageBox.No,
+                    QMessageBox.No
+                )
+                if reply != QMessageBox.Yes:
+                    return
+                recomecar = bool(checkpoint)
+
+            job = BackfillIBSCBS(self.db.db_path, pasta_xmls=DATA_DIR / "xmls", recomecar=recomecar)
+
+            class BackfillIBSCBSWorker(QThread):
+                progress = pyqtSignal(int, int, dict)
+                concluido = pyqtSignal(dict)
+                error = pyqtSignal(str)
+
+                def pausar(self):
+                    job.pausar()
+
+                def retomar(self):
+                    job.retomar()
+
+                def cancelar(self):
+                    job.cancelar()
+
+                def run(self):
+                    try:
+                        self.concluido.emit(job.executar(progresso=self.progress.emit))
+                    except Exception as e:
+                        import traceback
+                        traceback.print_exc()
+                        self.error.emit(str(e))
+
+            worker = BackfillIBSCBSWorker(self)
+            trabalho = {
+                'tipo': 'backfill_ibs_cbs',
+                'nome': 'Atualização de IBS/CBS das Notas',
+                'status': 'Em execução',
+                'progresso': 0,
+                'total': restantes if not recomecar else pendentes,
+                'mensagem': 'Localizando XMLs...',
+                'worker': worker
+            }
+            self._trabalhos_ativos.append(trabalho)
+
+            def on_progress(feitos, total, stats):
+                trabalho['progresso'] = feitos
+                trabalho['total'] = total
+                trabalho['mensagem'] = (
+                    f"✅ Atualizadas: {stats['atualizadas']} | ⚠️ XML não encontrado: {stats['nao_encontradas']} | "
+                    f"ℹ️ Sem valores: {stats['sem_valores']}"
+                )
+
+            def remover_trabalho():
+                self._trabalhos_ativos = [t for t in self._trabalhos_ativos if t is not trabalho]
+
+            def on_concluido(stats):
+                remover_trabalho()
+                if stats['cancelado']:
+                    self.set_status(f"⏹️ Atualização de IBS/CBS interrompida em {stats['processadas']}/{stats['total']} "
+                                    f"— execute novamente para continuar de onde parou", 8000)
+                else:
+                    self.set_status(f"✅ IBS/CBS: {stats['atualizadas']} nota(s) atualizada(s), "
+                                    f"{stats['nao_encontradas']} sem XML, {stats['sem_valores']} sem valores", 8000)
+                # Atualiza a interface se houve alterações
+                if stats['atualizadas'] > 0:
+                    print(f"✅ {stats['atualizadas']} notas foram atualizadas com IBS/CBS")
+                    self.refresh_all()
+
+            def on_error(msg):
+                remover_trabalho()
+                QMessageBox.critical(self, "Erro", f"Erro ao atualizar IBS/CBS: {msg}")
+
+            worker.progress.connect(on_progress)
+            worker.concluido.connect(on_concluido)
+            worker.error.connect(on_error)
+            worker.finished.connect(worker.deleteLater)
+            worker.start()
+            self.set_status("💰 Atualização de IBS/CBS iniciada em segundo plano — acompanhe no Gerenciador de Trabalhos (Ctrl+Shift+G)", 8000)
+
         except Exception as e:
             QMessageBox.critical(self, "Erro", f"Erro ao atualizar IBS/CBS: {e}")
             import traceback
             traceback.print_exc()
-    
+
+    def _indexar_itens_nfe(self):
+        """Liga a gravação dos itens (det) das NF-e em nfe_itens e indexa as notas já salvas."""
+        try:
+            from modules import nfe_itens
+
+            with self.db._connect() as conn:
+                ja_ativo = nfe_itens.ativo(conn)
+                concluido = nfe_itens.backfill_concluido(conn)
+
+            if ja_ativo and concluido:
+                QMessageBox.information(self, "Itens das NF-e",
+                                        "Os itens das NF-e já estão indexados.\n\n"
+                                        "Novas notas são indexadas automaticamente ao serem salvas.")
+                return
+
+            if not ja_ativo:
+                reply = QMessageBox.question(
+                    self,
+                    "Indexar Itens das NF-e",
+                    "Esta operação grava os itens das NF-e (produto, NCM, CFOP, quantidade e impostos, "
+                    "inclusive IBS/CBS) em uma tabela própria, para consultas por item.\n\n"
+                    "As notas já salvas são indexadas em segundo plano (Gerenciador de Trabalhos) e, "
+                    "a partir de agora, cada NF-e salva terá seus itens gravados.\n\n"
+                    "Deseja continuar?",
+                    QMessageBox.Yes | QMessageBox.No,
+                    QMessageBox.No
+                )
+                if reply != QMessageBox.Yes:
+                    return
+                with self.db._connect() as conn:
+                    nfe_itens.ativar(conn)
+
+            self._iniciar_indice_itens()
+            self.set_status("📦 Indexação de itens iniciada em segundo plano — acompanhe no Gerenciador de Trabalhos (Ctrl+Shift+G)", 8000)
+
+        except Exception as e:
+            QMessageBox.critical(self, "Erro", f"Erro ao indexar itens das NF-e: {e}")
+
     def _resetar_ordem_colunas(self):
         """Reseta a ordem das colunas para o padrão"""
         try:
@@ -3249,27 +3446,118 @@ class MainWindow(QMainWindow):
     def _on_nova_nota_callback(self, nota):
         """
         Callback chamado quando uma nova nota é salva no banco durante busca SEFAZ.
-        Adiciona a nota à lista self.notes e atualiza a tabela incrementalmente.
+        Agenda a mesclagem do delta (feed de alterações) em vez de reconstruir a
+        tabela — várias notas seguidas viram uma única sincronização.
         
         Args:
             nota (dict): Dicionário com dados da nota recém-salva
         """
         try:
-            # Adiciona nota à lista se não existir (evita duplicatas)
-            chave = nota.get('chave', '')
-            if chave and not any(n.get('chave', '') == chave for n in self.notes):
-                self.notes.append(nota)
-                logger.debug(f"🔄 Nova nota adicionada à interface: {chave} ({nota.get('tipo', 'NFe')})")
-                
-                # Dispara atualização da interface no thread principal
-                QTimer.singleShot(0, self._on_filter_changed)
+            logger.debug(f"🔄 Nova nota salva: {nota.get('chave', '')} ({nota.get('tipo', 'NFe')})")
+            if not self._delta_agendado:
+                self._delta_agendado = True
+                QTimer.singleShot(300, self._sincronizar_alteracoes)
         except Exception as e:
             logger.warning(f"⚠️ Erro no callback de nova nota: {e}")
 
+    def _sincronizar_alteracoes(self) -> bool:
+        """
+        Mescla em self.notes apenas as notas alteradas/removidas desde o último
+        número de sequência visto e atualiza a grade linha a linha.
+        
+        Retorna False quando é necessária uma recarga completa (primeira carga,
+        banco trocado, tabela ainda sendo montada ou limite de linhas atingido).
+        """
+        self._delta_agendado = False
+        if not self.notes or not self._notes_seq or self._table_filling:
+            return False
+        try:
+            alteradas, removidas, ultimo = self.db.load_alteracoes(self._notes_seq)
+        except Exception as e:
+            print(f"[DELTA] Erro ao ler alterações: {e}")
+            return False
+        if ultimo < self._notes_seq:
+            return False  # sequência voltou (backup restaurado) → recarga completa
+        if not alteradas and not removidas:
+            return True
+
+        # 1. Modelo (self.notes) — índice chave → posição reconstruído só se a lista mudou
+        if len(self._notes_idx) != len(self.notes):
+            self._notes_idx = {n.get('chave'): i for i, n in enumerate(self.notes)}
+        removidas_set = set(removidas)
+        chaves_alteradas = {it.get('chave') for it in alteradas}
+        for it in alteradas:
+            pos = self._notes_idx.get(it.get('chave'))
+            if pos is None:
+                self._notes_idx[it.get('chave')] = len(self.notes)
+                self.notes.append(it)
+            else:
+                self.notes[pos] = it
+        if removidas_set:
+            self.notes = [n for n in self.notes if n.get('chave') not in removidas_set]
+            self._notes_idx = {n.get('chave'): i for i, n in enumerate(self.notes)}
+        # XML de nota alterada pode ter vindo do banco (xml_completo): sai do cache de documentos
+        try:
+            from modules.documento_cache import obter_cache_documentos
+            obter_cache_documentos().invalidar(chaves_alteradas | removidas_set)
+        except Exception as e:
+            print(f"[DELTA] Erro ao invalidar cache de documentos: {e}")
+        # Notas recém-chegadas: PDF pré-gerado antes do primeiro duplo clique
+        try:
+            from modules.pdf_especulativo import obter_prerenderizador
+            obter_prerenderizador(self.db).recentes(
+                it.get('chave') for it in alteradas
+                if (it.get('xml_status') or '').upper() == 'COMPLETO' and not it.get('pdf_path'))
+        except Exception as e:
+            print(f"[PDF-ESPECULATIVO] Erro ao enfileirar recentes: {e}")
+
+        # 2. Grade — só as linhas afetadas
+        visiveis = {it.get('chave') for it in self.filtered(alteradas)}
+        limit_text = self.limit_dd.currentText()
+        limite = None if limit_text == "Todos" else int(limit_text)
+        novas = sum(1 for c in visiveis if c not in self._linhas_por_chave)
+        if limite and self.table.rowCount() + novas > limite:
+            return False
+        try:
+            sorting = self.table.isSortingEnabled()
+            self.table.setSortingEnabled(False)
+            for chave in removidas_set | (chaves_alteradas - visiveis):
+                item = self._linhas_por_chave.pop(chave, None)
+                if item is not None:
+                    self.table.removeRow(item.row())
+            for it in alteradas:
+                chave = it.get('chave')
+                if chave not in visiveis:
+                    continue
+                item = self._linhas_por_chave.get(chave)
+                if item is not None:
+                    r = item.row()
+                else:
+                    r = self.table.rowCount()
+                    self.table.insertRow(r)
+                self._populate_row(r, it)
+            self.table.setSortingEnabled(sorting)
+        except RuntimeError:
+            return False  # item da grade já destruído → recarga completa
+
+        self._table_fill_items = [
+            it for it in (self._table_fill_items or [])
+            if it.get('chave') not in removidas_set and it.get('chave') not in chaves_alteradas
+        ] + [it for it in alteradas if it.get('chave') in visiveis]
+        self._update_totais(self._table_fill_items)
+        self._notes_seq = ultimo
+        # Aba "Emitidos pela empresa" consulta o banco com filtros próprios
+        self.refresh_emitidos_table()
+        self.set_status(f"🔄 {len(alteradas)} alterada(s), {len(removidas)} removida(s)", 3000)
+        return True
+
     def refresh_all(self):
         # Evita reentrância e trava de UI: carrega notas em thread
         if self._loading_notes:
             return
+        # Já carregado: mescla só o delta do feed de alterações
+        if self._sincronizar_alteracoes():
+            return
         self._loading_notes = True
         try:
             if self.btn_refresh:
@@ -3279,21 +3567,26 @@ class MainWindow(QMainWindow):
         self.set_status("Carregando…")
 
         class LoadNotesWorker(QThread):
-            finished_notes = pyqtSignal(list)
+            finished_notes = pyqtSignal(list, int)
             def __init__(self, db: UIDB, limit: int = 5000):
                 super().__init__()
                 self.db = db
                 self.limit = limit
             def run(self):
                 try:
+                    # Sequência lida ANTES da carga: o que mudar durante a leitura
+                    # reaparece no próximo delta (mesclagem é idempotente)
+                    seq = self.db.ultima_alteracao_seq()
                     notes = self.db.load_notes(limit=self.limit)
                 except Exception:
-                    notes = []
-                self.finished_notes.emit(notes)
+                    seq, notes = 0, []
+                self.finished_notes.emit(notes, seq)
 
-        def on_loaded(notes: List[Dict[str, Any]]):
+        def on_loaded(notes: List[Dict[str, Any]], seq: int = 0):
             try:
                 self.notes = notes or []
+                self._notes_seq = seq
+                self._notes_idx = {}
                 
                 # 📌 OTIMIZAÇÃO: Correção automática removida da inicialização
                 # A correção agora é executada apenas:
@@ -3541,7 +3834,7 @@ class MainWindow(QMainWindow):
                             row_xb = cursor.fetchone()
                             if row_xb:
                                 caminho_xb, xml_completo_xb = row_xb
-                                if caminho_xb and Path(caminho_xb).exists():
+                                if caminho_xb and caminho_existe(caminho_xb):
                                     arquivo_existe = True
                                 elif xml_completo_xb:
                                     arquivo_existe = True
@@ -3765,7 +4058,8 @@ class MainWindow(QMainWindow):
         except Exception as e:
             print(f"[DEBUG] Erro ao atualizar tabelas após filtro: {e}")
 
-    def filtered(self) -> List[Dict[str, Any]]:
+    def filtered(self, notes: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Aplica os filtros da aba a `notes` (padrão: self.notes)."""
         q = (self.search_edit.text() or "").lower().strip()
         selected_cert = getattr(self, '_selected_cert_cnpj', None)
         st = (self.status_dd.currentText() or "Todos").lower()
@@ -3822,8 +4116,19 @@ class MainWindow(QMainWindow):
             print(f"[DEBUG] Erro ao carregar certificados para filtro: {e}")
             company_cnpjs = set()
         
+        # "Cancelado" também pega notas com evento de cancelamento indexado
+        # cujo status ainda não foi atualizado (consulta indexada, sem varrer pastas)
+        canceladas_indice = set()
+        if st == "cancelado":
+            try:
+                from modules.eventos_index import chaves_canceladas
+                with self.db._connect() as conn:
+                    canceladas_indice = chaves_canceladas(conn)
+            except Exception as e:
+                print(f"[DEBUG] Erro ao consultar índice de eventos: {e}")
+        
         out: List[Dict[str, Any]] = []
-        for it in (self.notes or []):
+        for it in (self.notes if notes is None else notes) or []:
             # NÃO MOSTRAR eventos na interface (apenas armazenar em disco)
             xml_status = (it.get('xml_status') or '').upper()
             if xml_status == 'EVENTO':
@@ -3898,7 +4203,7 @@ class MainWindow(QMainWindow):
                     elif st == "denegado":
                         search_term = "denega"
                     
-                    if search_term not in status_nota:
+                    if search_term not in status_nota and it.get("chave") not in canceladas_indice:
                         continue
                 except Exception:
                     continue
@@ -4071,7 +4376,11 @@ class MainWindow(QMainWindow):
                         elif st == "denegado":
                             search_term = "denega"
                         
-                        where_clauses.append("LOWER(status) LIKE ?")
+                        if st == "cancelado":
+                            from modules.eventos_index import sql_cancelada
+                            where_clauses.append(f"(LOWER(status) LIKE ? OR {sql_cancelada('notas_detalhadas.chave')})")
+                        else:
+                            where_clauses.append("LOWER(status) LIKE ?")
                         params.append(f"%{search_term}%")
                     except Exception as e:
                         print(f"[DEBUG] Erro ao aplicar filtro de status: {e}")
@@ -4299,6 +4608,16 @@ class MainWindow(QMainWindow):
         
         return (valor_formatado, valor_num)
     
+    def _valor_normalizado(self, it: Dict[str, Any], campo: str) -> tuple:
+        """
+        Como _parse_valor, mas usa a coluna {campo}_centavos quando o item a tem
+        (preenchida por gatilho no banco). Retorna: (valor_formatado, valor_num)
+        """
+        centavos = it.get(f"{campo}_centavos")
+        if centavos is None or not it.get(campo):
+            return self._parse_valor(it.get(campo))
+        return (formatar_centavos(centavos), centavos / 100)
+    
     def _codigo_uf_to_sigla(self, codigo: str) -> str:
         """Converte código UF para sigla."""
         if not codigo:
@@ -4422,6 +4741,9 @@ class MainWindow(QMainWindow):
                     cte += 1
                 elif 'NFS' in tipo_raw:
                     nfse += 1
+                if it.get('valor_centavos') is not None:
+                    total_valor += it['valor_centavos'] / 100
+                    continue
                 try:
                     total_valor += float(it.get('valor') or 0)
                 except Exception:
@@ -4454,6 +4776,7 @@ class MainWindow(QMainWindow):
             self.table.setSortingEnabled(False)
         except Exception:
             self._restore_sorting = False
+        self._linhas_por_chave = {}
         try:
             self.table.clearContents()
             self.table.setRowCount(len(items))
@@ -4595,7 +4918,7 @@ class MainWindow(QMainWindow):
         elif xml_status == "INDISPONIVEL":
             status_text = ""  # Sem ícone
             bg_color = QColor(cor_outros).darker(110)  # Cinza levemente mais escuro
-            tooltip_text = "🚫 XML indisponível no SEFAZ (prazo expirado ou NF-e inexistente)"
+            tooltip_text = "🚫 XML indisponível no SEFAZ (prazo expirado, NF-e inexistente ou ainda não liberado — nova tentativa automática)"
             icon_name = None
             xml_sort_order = 5  # Indisponível (pior)
         else:  # RESUMO
@@ -4651,22 +4974,26 @@ class MainWindow(QMainWindow):
                 except Exception:
                     data_emissao_raw = ""
         
-        data_emissao_br = self._format_date_br(data_emissao_raw) if data_emissao_raw else "(Sem data)"
-        # Converte data para timestamp para ordenação correta
-        try:
-            if data_emissao_raw and len(data_emissao_raw) >= 10:
-                from datetime import datetime
-                dt = datetime.strptime(data_emissao_raw[:10], "%Y-%m-%d")
-                timestamp = dt.timestamp()
-            else:
-                timestamp = 9999999999.0  # Coloca sem data no final ao ordenar
-        except Exception:
-            timestamp = 9999999999.0
+        # Colunas normalizadas (data_emissao_iso/epoch) dispensam o parse do texto
+        if it.get("data_emissao_iso") and it.get("data_emissao_epoch") is not None:
+            data_emissao_br = iso_para_br(it["data_emissao_iso"])
+            timestamp = float(it["data_emissao_epoch"])
+        else:
+            data_emissao_br = self._format_date_br(data_emissao_raw) if data_emissao_raw else "(Sem data)"
+            # Converte data para timestamp para ordenação correta
+            try:
+                if data_emissao_raw and len(data_emissao_raw) >= 10:
+                    from datetime import datetime
+                    dt = datetime.strptime(data_emissao_raw[:10], "%Y-%m-%d")
+                    timestamp = dt.timestamp()
+                else:
+                    timestamp = 9999999999.0  # Coloca sem data no final ao ordenar
+            except Exception:
+                timestamp = 9999999999.0
         self.table.setItem(r, 2, NumericTableWidgetItem(data_emissao_br, timestamp))
         self.table.setItem(r, 3, cell(it.get("tipo")))
         # Coluna Valor - ordenação numérica com exibição formatada
-        valor_raw = it.get("valor")
-        valor_formatado, valor_num = self._parse_valor(valor_raw)
+        valor_formatado, valor_num = self._valor_normalizado(it, "valor")
         c_val = NumericTableWidgetItem(valor_formatado, valor_num)
         c_val.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self.table.setItem(r, 4, c_val)
@@ -4695,30 +5022,26 @@ class MainWindow(QMainWindow):
         self.table.setItem(r, 9, cell(self._codigo_uf_to_sigla(it.get("uf") or "")))
         
         # Coluna Base ICMS - ordenação numérica com formatação BR
-        base_icms_raw = it.get("base_icms")
-        base_icms_formatado, base_icms_num = self._parse_valor(base_icms_raw)
+        base_icms_formatado, base_icms_num = self._valor_normalizado(it, "base_icms")
         c_base = NumericTableWidgetItem(base_icms_formatado, base_icms_num)
         c_base.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self.table.setItem(r, 10, c_base)
         
         # Coluna Valor ICMS - ordenação numérica com formatação BR
-        valor_icms_raw = it.get("valor_icms")
-        valor_icms_formatado, valor_icms_num = self._parse_valor(valor_icms_raw)
+        valor_icms_formatado, valor_icms_num = self._valor_normalizado(it, "valor_icms")
         c_icms = NumericTableWidgetItem(valor_icms_formatado, valor_icms_num)
         c_icms.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self.table.setItem(r, 11, c_icms)
         
         # Coluna IBS (Reforma Tributária) - ordenação numérica com formatação BR
-        v_ibs_raw = it.get("v_ibs") or ""
-        v_ibs_formatado, v_ibs_num = self._parse_valor(v_ibs_raw)
+        v_ibs_formatado, v_ibs_num = self._valor_normalizado(it, "v_ibs")
         c_ibs = NumericTableWidgetItem(v_ibs_formatado, v_ibs_num)
         c_ibs.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         c_ibs.setToolTip("IBS - Imposto sobre Bens e Serviços (Reforma Tributária)")
         self.table.setItem(r, 12, c_ibs)
         
         # Coluna CBS (Reforma Tributária) - ordenação numérica com formatação BR
-        v_cbs_raw = it.get("v_cbs") or ""
-        v_cbs_formatado, v_cbs_num = self._parse_valor(v_cbs_raw)
+        v_cbs_formatado, v_cbs_num = self._valor_normalizado(it, "v_cbs")
         c_cbs = NumericTableWidgetItem(v_cbs_formatado, v_cbs_num)
         c_cbs.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         c_cbs.setToolTip("CBS - Contribuição sobre Bens e Serviços (Reforma Tributária)")
@@ -4732,7 +5055,10 @@ class MainWindow(QMainWindow):
         self.table.setItem(r, 15, cell(it.get("cfop")))
         self.table.setItem(r, 16, cell(it.get("ncm")))
         self.table.setItem(r, 17, cell(it.get("ie_tomador")))
-        self.table.setItem(r, 18, cell(it.get("chave")))
+        c_chave = cell(it.get("chave"))
+        self.table.setItem(r, 18, c_chave)
+        # Localiza a linha da chave no delta (item.row() acompanha a ordenação)
+        self._linhas_por_chave[it.get("chave")] = c_chave
     
     def _populate_emitidos_row(self, r: int, it: Dict[str, Any]):
         """Popula uma linha da tabela de emitidos (mesma estrutura que _populate_row)"""
@@ -4793,7 +5119,7 @@ class MainWindow(QMainWindow):
         elif xml_status == "INDISPONIVEL":
             status_text = ""  # Sem ícone
             bg_color = QColor(cor_outros).darker(110)  # Cinza levemente mais escuro
-            tooltip_text = "🚫 XML indisponível no SEFAZ (prazo expirado ou NF-e inexistente)"
+            tooltip_text = "🚫 XML indisponível no SEFAZ (prazo expirado, NF-e inexistente ou ainda não liberado — nova tentativa automática)"
             icon_name = None
             xml_sort_order = 5  # Indisponível (pior)
         else:  # RESUMO
@@ -4853,23 +5179,27 @@ class MainWindow(QMainWindow):
                 except Exception:
                     data_emissao_raw = ""
         
-        data_emissao_br = self._format_date_br(data_emissao_raw) if data_emissao_raw else "(Sem data)"
-        try:
-            if data_emissao_raw and len(data_emissao_raw) >= 10:
-                from datetime import datetime
-                dt = datetime.strptime(data_emissao_raw[:10], "%Y-%m-%d")
-                timestamp = dt.timestamp()
-            else:
-                timestamp = 9999999999.0  # Coloca sem data no final
-        except Exception:
-            timestamp = 9999999999.0
+        # Colunas normalizadas (data_emissao_iso/epoch) dispensam o parse do texto
+        if it.get("data_emissao_iso") and it.get("data_emissao_epoch") is not None:
+            data_emissao_br = iso_para_br(it["data_emissao_iso"])
+            timestamp = float(it["data_emissao_epoch"])
+        else:
+            data_emissao_br = self._format_date_br(data_emissao_raw) if data_emissao_raw else "(Sem data)"
+            try:
+                if data_emissao_raw and len(data_emissao_raw) >= 10:
+                    from datetime import datetime
+                    dt = datetime.strptime(data_emissao_raw[:10], "%Y-%m-%d")
+                    timestamp = dt.timestamp()
+                else:
+                    timestamp = 9999999999.0  # Coloca sem data no final
+            except Exception:
+                timestamp = 9999999999.0
         self.table_emitidos.setItem(r, 2, NumericTableWidgetItem(data_emissao_br, timestamp))
         
         self.table_emitidos.setItem(r, 3, cell(it.get("tipo")))
         
         # Coluna Valor - ordenação numérica com exibição formatada
-        valor_raw = it.get("valor")
-        valor_formatado, valor_num = self._parse_valor(valor_raw)
+        valor_formatado, valor_num = self._valor_normalizado(it, "valor")
         c_val = NumericTableWidgetItem(valor_formatado, valor_num)
         c_val.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self.table_emitidos.setItem(r, 4, c_val)
@@ -4904,30 +5234,26 @@ class MainWindow(QMainWindow):
         self.table_emitidos.setItem(r, 9, cell(self._codigo_uf_to_sigla(it.get("uf") or "")))
         
         # Coluna Base ICMS - ordenação numérica com formatação BR
-        base_icms_raw = it.get("base_icms")
-        base_icms_formatado, base_icms_num = self._parse_valor(base_icms_raw)
+        base_icms_formatado, base_icms_num = self._valor_normalizado(it, "base_icms")
         c_base = NumericTableWidgetItem(base_icms_formatado, base_icms_num)
         c_base.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self.table_emitidos.setItem(r, 10, c_base)
         
         # Coluna Valor ICMS - ordenação numérica com formatação BR
-        valor_icms_raw = it.get("valor_icms")
-        valor_icms_formatado, valor_icms_num = self._parse_valor(valor_icms_raw)
+        valor_icms_formatado, valor_icms_num = self._valor_normalizado(it, "valor_icms")
         c_icms = NumericTableWidgetItem(valor_icms_formatado, valor_icms_num)
         c_icms.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self.table_emitidos.setItem(r, 11, c_icms)
         
         # Coluna IBS (Reforma Tributária) - ordenação numérica com formatação BR
-        v_ibs_raw = it.get("v_ibs") or ""
-        v_ibs_formatado, v_ibs_num = self._parse_valor(v_ibs_raw)
+        v_ibs_formatado, v_ibs_num = self._valor_normalizado(it, "v_ibs")
         c_ibs = NumericTableWidgetItem(v_ibs_formatado, v_ibs_num)
         c_ibs.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         c_ibs.setToolTip("IBS - Imposto sobre Bens e Serviços (Reforma Tributária)")
         self.table_emitidos.setItem(r, 12, c_ibs)
         
         # Coluna CBS (Reforma Tributária) - ordenação numérica com formatação BR
-        v_cbs_raw = it.get("v_cbs") or ""
-        v_cbs_formatado, v_cbs_num = self._parse_valor(v_cbs_raw)
+        v_cbs_formatado, v_cbs_num = self._valor_normalizado(it, "v_cbs")
         c_cbs = NumericTableWidgetItem(v_cbs_formatado, v_cbs_num)
         c_cbs.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
         c_cbs.setToolTip("CBS - Contribuição sobre Bens e Serviços (Reforma Tributária)")
@@ -4966,6 +5292,7 @@ class MainWindow(QMainWindow):
                     pass
                 self.set_status(f"{total} registros carregados", 2000)
                 self._update_totais(self._table_fill_items)
+                self._prerender_timer.start()
                 
                 # ⚠️ AUTO-VERIFICAÇÃO REMOVIDA DAQUI
                 # Agora está disponível no Gerenciador de Trabalhos (Ctrl+Shift+G)
@@ -5432,6 +5759,13 @@ class MainWindow(QMainWindow):
         
         # Opção: Ver Detalhes Completos (sempre disponível)
         action_detalhes = menu.addAction("📄 Ver Detalhes Completos")
+
+        # Opção: PDF único (DANFE/DACTE das selecionadas num arquivo só, com marcadores)
+        _lbl_pdf = (f"🖨️ PDF Único para Impressão ({len(selected_rows)} notas)"
+                    if len(selected_rows) > 1 else "🖨️ PDF para Impressão")
+        action_pdf_unico = menu.addAction(_lbl_pdf)
+        action_pdf_unico.setToolTip("Gera os PDFs que faltam e junta todos num único arquivo, "
+                                    "na ordem da tabela, com um marcador por documento")
         
         # Opção: Eventos (sempre disponível)
         menu.addSeparator()
@@ -5470,6 +5804,8 @@ class MainWindow(QMainWindow):
                 self._baixar_xml_e_pdf(item)  # Método direto para uma nota
         elif action == action_detalhes:
             self._mostrar_detalhes_nota(item)
+        elif action == action_pdf_unico:
+            self._gerar_pdf_unico(sorted(selected_rows))
         elif action == action_eventos:
             self._mostrar_eventos(item)
         elif action == action_manifestar:
@@ -5536,10 +5872,12 @@ class MainWindow(QMainWindow):
             cancelamento = _pyqtSignal(str, str)       # (chave, informante)
             concluido = _pyqtSignal(list, list)        # (cancelados, erros)
 
-            def __init__(self, notas, certs):
+            def __init__(self, notas, certs, db_path, canceladas_indice):
                 super().__init__()
                 self._notas = notas
                 self._certs = certs
+                self._db_path = db_path
+                self._canceladas = canceladas_indice   # None: índice de eventos ainda incompleto
                 self._parar = False
 
             def stop(self):
@@ -5586,40 +5924,44 @@ class MainWindow(QMainWindow):
                     status_atual = (nota.get('status') or '').lower()
                     self.progresso.emit(idx, chave[:20] + '…')
 
-                    # ── Passo 1: verifica arquivos locais de evento ──────────
+                    # ── Passo 1: verifica eventos locais (índice de eventos) ──
                     ja_cancelado_local = False
-                    try:
-                        from pathlib import Path as _Path
-                        xmls_root = DATA_DIR / "xmls"
-                        # ⚡ Busca OTIMIZADA: caminho direto ao invés de rglob("Eventos")
-                        _ev_folders_lote = []
-                        if informante and len(chave) >= 6:
-                            _aa_l, _mm_l = chave[2:4], chave[4:6]
-                            _direct_l = xmls_root / informante / f"20{_aa_l}-{_mm_l}" / "Eventos"
-                            if _direct_l.is_dir():
-                                _ev_folders_lote.append(_direct_l)
-                        if not _ev_folders_lote:
-                            try:
-                                for _cd_l in xmls_root.iterdir():
-                                    if not _cd_l.is_dir():
-                                        continue
-                                    for _md_l in _cd_l.iterdir():
-                                        if not _md_l.is_dir():
+                    if self._canceladas is not None:
+                        ja_cancelado_local = chave in self._canceladas
+                    else:
+                        # Índice ainda em construção: varre a pasta Eventos/ como antes
+                        try:
+                            from pathlib import Path as _Path
+                            xmls_root = DATA_DIR / "xmls"
+                            # ⚡ Busca OTIMIZADA: caminho direto ao invés de rglob("Eventos")
+                            _ev_folders_lote = []
+                            if informante and len(chave) >= 6:
+                                _aa_l, _mm_l = chave[2:4], chave[4:6]
+                                _direct_l = xmls_root / informante / f"20{_aa_l}-{_mm_l}" / "Eventos"
+                                if _direct_l.is_dir():
+                                    _ev_folders_lote.append(_direct_l)
+                            if not _ev_folders_lote:
+                                try:
+                                    for _cd_l in xmls_root.iterdir():
+                                        if not _cd_l.is_dir():
                                             continue
-                                        _ev_l = _md_l / "Eventos"
-                                        if _ev_l.is_dir():
-                                            _ev_folders_lote.append(_ev_l)
-                            except Exception:
-                                pass
-                        for ev_folder in _ev_folders_lote:
-                            for xf in ev_folder.glob("*.xml"):
-                                if chave in xf.name and '110111' in xf.name:
-                                    ja_cancelado_local = True
+                                        for _md_l in _cd_l.iterdir():
+                                            if not _md_l.is_dir():
+                                                continue
+                                            _ev_l = _md_l / "Eventos"
+                                            if _ev_l.is_dir():
+                                                _ev_folders_lote.append(_ev_l)
+                                except Exception:
+                                    pass
+                            for ev_folder in _ev_folders_lote:
+                                for xf in ev_folder.glob("*.xml"):
+                                    if chave in xf.name and '110111' in xf.name:
+                                        ja_cancelado_local = True
+                                        break
+                                if ja_cancelado_local:
                                     break
-                            if ja_cancelado_local:
-                                break
-                    except Exception:
-                        pass
+                        except Exception:
+                            pass
 
                     if ja_cancelado_local and 'cancel' not in status_atual:
                         self.cancelamento.emit(chave, informante)
@@ -5675,6 +6017,7 @@ class MainWindow(QMainWindow):
                                     cam = pasta_ev / nome_arq
                                     if not cam.exists():
                                         cam.write_bytes(_et.tostring(ev_el, encoding='utf-8', xml_declaration=True))
+                                    indexar_no_banco(self._db_path, cam, cert_cnpj)
                                 except Exception:
                                     pass
 
@@ -5687,7 +6030,16 @@ class MainWindow(QMainWindow):
 
                 self.concluido.emit(_cancelados, _erros)
 
-        worker = LoteEventosWorker(notas_consultar, certs)
+        from modules.eventos_index import backfill_concluido, chaves_canceladas, indexar_no_banco
+        canceladas_indice = None
+        try:
+            with self.db._connect() as conn:
+                if backfill_concluido(conn):
+                    canceladas_indice = chaves_canceladas(conn)
+        except Exception as e:
+            print(f"[EVENTOS-LOTE] Índice de eventos indisponível: {e}")
+
+        worker = LoteEventosWorker(notas_consultar, certs, self.db.db_path, canceladas_indice)
 
         def _on_progresso(idx, chave_curta):
             progress.setValue(idx)
@@ -6349,6 +6701,136 @@ class MainWindow(QMainWindow):
             self.set_status(f"Erro: {str(e)}", 5000)
             QMessageBox.critical(self, "Erro", f"Erro ao buscar XML completo:\n\n{str(e)}")
     
+    def _gerar_pdf_unico(self, selected_rows: list):
+        """
+        Junta os DANFE/DACTE das linhas selecionadas num único PDF para
+        impressão (modules/pdf_combinado): PDFs que faltam são gerados em
+        paralelo, a ordem é a da tabela e cada documento ganha um marcador.
+        """
+        chave_col_index = None
+        for col in range(self.table.columnCount()):
+            header_item = self.table.horizontalHeaderItem(col)
+            if header_item and header_item.text() == "Chave":
+                chave_col_index = col
+                break
+        if chave_col_index is None:
+            QMessageBox.warning(self, "Erro", "Coluna 'Chave' não encontrada!")
+            return
+
+        from modules.pdf_combinado import DocumentoPDF, pdf_unico
+
+        documentos = []
+        try:
+            with self.db._connect() as conn:
+                for row in selected_rows:
+                    chave_item = self.table.item(row, chave_col_index)
+                    chave = chave_item.text().strip() if chave_item else ''
+                    if not chave:
+                        continue
+                    nota = conn.execute(
+                        "SELECT tipo, numero, nome_emitente FROM notas_detalhadas WHERE chave = ?",
+                        (chave,)).fetchone()
+                    tipo, numero, emitente = nota if nota else ('', '', '')
+                    pdf = self._encontrar_arquivo_pdf(chave)
+                    xml = None if pdf else self._encontrar_arquivo_xml(chave)
+                    tipo_pdf = (tipo or 'NFe').upper().replace('-', '').replace('_', '')
+                    documentos.append(DocumentoPDF(
+                        chave=chave,
+                        titulo=f"Nº {numero or '?'} — {emitente or 'Emitente não informado'} ({chave})",
+                        pdf_path=str(pdf) if pdf else '',
+                        xml_path=str(xml) if xml else '',
+                        tipo={'CTE': 'CTe', 'NFCE': 'NFCe', 'NFSE': 'NFS-e'}.get(tipo_pdf, 'NFe'),
+                    ))
+        except Exception as e:
+            QMessageBox.warning(self, "PDF Único", f"Erro ao localizar os documentos: {e}")
+            return
+        if not documentos:
+            QMessageBox.warning(self, "PDF Único", "Nenhuma nota válida selecionada!")
+            return
+
+        sugestao = str(Path.home() / f"impressao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
+        destino, _ = QFileDialog.getSaveFileName(self, "Salvar PDF único", sugestao, "PDF (*.pdf)")
+        if not destino:
+            return
+
+        class PDFUnicoWorker(QThread):
+            progresso = pyqtSignal(str, int, int)   # etapa, feitos, total
+            concluido = pyqtSignal(object)          # stats de pdf_unico
+            erro = pyqtSignal(str)
+
+            def run(self):
+                try:
+                    stats = pdf_unico(documentos, destino,
+                                      progresso=lambda etapa, feitos, total: self.progresso.emit(etapa, feitos, total),
+                                      cancelado=self.isInterruptionRequested)
+                    self.concluido.emit(stats)
+                except Exception as e:
+                    import traceback
+                    traceback.print_exc()
+                    self.erro.emit(str(e))
+
+        progress = QProgressDialog("Preparando PDF único...", "Cancelar", 0, len(documentos), self)
+        progress.setWindowTitle("PDF Único")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        progress.show()
+
+        worker = PDFUnicoWorker()
+        self._pdf_unico_worker = worker
+
+        def _on_progresso(etapa, feitos, total):
+            progress.setMaximum(max(total, 1))
+            progress.setValue(feitos)
+            verbo = "Gerando PDFs que faltam" if etapa == 'gerando' else "Juntando documentos"
+            progress.setLabelText(f"{verbo}... {feitos}/{total}")
+
+        def _on_concluido(stats):
+            progress.close()
+            # PDFs gerados agora passam a ser encontrados pelo cache (notas_detalhadas)
+            import tempfile
+            for chave, pdf, pdf_tipo in stats.get('gerados', []):
+                if not str(pdf).startswith(tempfile.gettempdir()):  # XML arquivado extraído: PDF é descartável
+                    try:
+                        self.db.atualizar_pdf_path(chave, str(Path(pdf).resolve()), pdf_tipo)
+                    except Exception as e_reg:
+                        print(f"[AVISO] Erro ao registrar pdf_path de {chave}: {e_reg}")
+            if stats.get('cancelado'):
+                QMessageBox.information(self, "PDF Único", "Geração cancelada — nenhum arquivo foi salvo.")
+                return
+            if not stats.get('paginas'):
+                QMessageBox.warning(self, "PDF Único", "Nenhum PDF pôde ser gerado ou lido para as notas selecionadas.")
+                return
+            msg = (f"{stats['documentos']} documento(s), {stats['paginas']} página(s)\n"
+                   f"Arquivo: {destino}")
+            if stats.get('gerados'):
+                msg += f"\n\n{len(stats['gerados'])} PDF(s) gerado(s) agora."
+            faltando = len(stats.get('sem_pdf', [])) + len(stats.get('falhas', []))
+            if faltando:
+                msg += f"\n⚠️ {faltando} documento(s) ficaram de fora (sem XML/PDF ou PDF ilegível)."
+            if QMessageBox.question(self, "PDF Único", msg + "\n\nAbrir o arquivo agora?",
+                                    QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
+                try:
+                    os.startfile(destino)
+                except Exception as e:
+                    QMessageBox.warning(self, "PDF Único", f"Não foi possível abrir o PDF: {e}")
+
+        def _on_erro(mensagem):
+            progress.close()
+            QMessageBox.critical(self, "PDF Único", f"Erro ao gerar o PDF único:\n{mensagem}")
+
+        def _on_finished():
+            self._pdf_unico_worker = None
+            worker.deleteLater()
+
+        progress.canceled.connect(worker.requestInterruption)
+        worker.progresso.connect(_on_progresso)
+        worker.concluido.connect(_on_concluido)
+        worker.erro.connect(_on_erro)
+        worker.finished.connect(_on_finished)
+        worker.start()
+
     def _baixar_xml_e_pdf_multiplos(self, selected_rows: list):
         """
         Baixa XMLs completos para múltiplas notas selecionadas.
@@ -6641,6 +7123,8 @@ class MainWindow(QMainWindow):
                                             _dest_ev_perf.write_text(xml_resposta, encoding='utf-8')
                                 except Exception as _pe_ev:
                                     print(f"[MANIFESTAÇÃO] Aviso ao salvar evento nos perfis: {_pe_ev}")
+                                from modules.eventos_index import indexar_no_banco
+                                indexar_no_banco(self.db.db_path, _dest_ev_local, _inf_ev)
                                 print(f"[MANIFESTAÇÃO] 💾 XML evento salvo: {_dest_ev_local}")
                             except Exception as _se_ev:
                                 print(f"[MANIFESTAÇÃO] Aviso ao salvar XML do evento: {_se_ev}")
@@ -7435,12 +7919,23 @@ class MainWindow(QMainWindow):
         if not chave or len(chave) != 44:
             return
         
-        # Verifica se já tem o evento localmente
+        # Verifica se já tem o evento localmente (índice de eventos)
         xmls_root = DATA_DIR / "xmls"
         evento_encontrado = False
+        indice_completo = False
+        try:
+            from modules.eventos_index import backfill_concluido, cancelada
+            with self.db._connect() as conn:
+                if cancelada(conn, chave):
+                    self.set_status("✅ Evento de cancelamento já está salvo localmente", 3000)
+                    return
+                indice_completo = backfill_concluido(conn)
+        except Exception:
+            pass
         
         try:
-            if xmls_root.exists():
+            # Índice ainda em construção: varre a pasta Eventos/ como antes
+            if not indice_completo and xmls_root.exists():
                 # ⚡ Busca OTIMIZADA: caminho direto (informante/AAMM/Eventos) ao invés de rglob
                 evento_folders_check = []
                 _inf_cancel = item.get('informante', '')
@@ -7462,11 +7957,12 @@ class MainWindow(QMainWindow):
                                     evento_folders_check.append(_ev)
                     except Exception:
                         pass
+                from modules.documento_cache import evento_do_arquivo
                 for ev_folder in evento_folders_check:
                     for xml_file in ev_folder.glob("*.xml"):
                         try:
-                            xml_content = xml_file.read_text(encoding='utf-8')
-                            if chave in xml_content and '110111' in xml_content:
+                            ev = evento_do_arquivo(xml_file, chave)
+                            if ev is not None and ev['tp_evento'] == '110111':
                                 evento_encontrado = True
                                 self.set_status("✅ Evento de cancelamento já está salvo localmente", 3000)
                                 return
@@ -7518,8 +8014,12 @@ class MainWindow(QMainWindow):
                     cnpj_informante = informante or cert_to_use.get('cnpj_cpf')
                     nome_cert = cert_to_use.get('nome_certificado')
                     
-                    # 1. Salva em backup local (xmls/)
-                    salvar_xml_por_certificado(xml_resposta, cnpj_informante, pasta_base="xmls")
+                    # 1. Salva em backup local (xmls/) e registra no índice de eventos
+                    resultado = salvar_xml_por_certificado(xml_resposta, cnpj_informante, pasta_base="xmls")
+                    caminho_ev = resultado[0] if isinstance(resultado, tuple) else resultado
+                    if caminho_ev:
+                        from modules.eventos_index import indexar_no_banco
+                        indexar_no_banco(self.db.db_path, caminho_ev, cnpj_informante)
                     
                     # 2. Salva em TODOS os perfis ativos (pasta_base=None)
                     salvar_xml_por_certificado(xml_resposta, cnpj_informante, pasta_base=None, nome_certificado=nome_cert)
@@ -7539,7 +8039,7 @@ class MainWindow(QMainWindow):
             if 'Vinculado' not in relacao:
                 QMessageBox.information(dialog_parent, "Info", 
                     "Este é um evento deste documento.\n\n"
-                    "Duplo-clique funciona apenas em documentos VINCULADOS (aba Vínculos).")
+                    "Duplo-clique funciona apenas em documentos VINCULADOS (aba Documentos relacionados).")
                 return
             
             # Para documentos vinculados, precisa extrair a chave do caminho do arquivo
@@ -8021,10 +8521,56 @@ class MainWindow(QMainWindow):
                     except Exception as e:
                         print(f"[DEBUG] Erro ao buscar manifestações: {e}")
 
-                    # 2️⃣ Procura EVENTOS diretos do documento
-                    print(f"[DEBUG] 2️⃣ Buscando eventos em pastas Eventos...")
+                    # 2️⃣ Procura EVENTOS diretos do documento (índice de eventos)
+                    from modules.documento_cache import evento_do_arquivo, vinculo_do_arquivo
+                    from modules.eventos_index import backfill_concluido, eventos_da_chave
                     xmls_root = DATA_DIR / "xmls"
-                    if xmls_root.exists():
+                    tipos_eventos_map = {
+                        '110111': '❌ Cancelamento',
+                        '110110': '✏️ Carta de Correção',
+                        '210200': '📬 Confirmação da Operação',
+                        '210210': '❓ Ciência da Operação',
+                        '210220': '⛔ Desconhecimento da Operação',
+                        '210240': '🚫 Operação não Realizada',
+                        '110140': '🔒 EPEC (Contingência)',
+                        '610130': '🚛 CTe Autorizado', '610131': '🚛 CTe Cancelado',
+                        '610500': '📦 MDFe Autorizado', '610510': '📦 MDFe Cancelado',
+                        '610514': '📦 MDFe com CTe', '610600': '🚛 CTe Vinculado à NFe',
+                        '610601': '🚛 CTe Desvinculado da NFe',
+                        '610610': '📦 MDFe Vinculado à NFe',
+                        '610611': '📦 MDFe Desvinculado da NFe',
+                        '610614': '📦 MDFe Autorizado com CTe',
+                        '610615': '📦 MDFe Cancelado com CTe',
+                        'STATUS': '📋 Status SEFAZ (ConsultaProtocolo)',
+                    }
+                    indice_completo = False
+                    eventos_indice = []
+                    try:
+                        with self._db._connect() as _conn_ev:
+                            indice_completo = backfill_concluido(_conn_ev)
+                            eventos_indice = eventos_da_chave(_conn_ev, chave)
+                    except Exception as e:
+                        print(f"[DEBUG] Índice de eventos indisponível: {e}")
+                    print(f"[DEBUG] 2️⃣ {len(eventos_indice)} evento(s) no índice (completo={indice_completo})")
+                    for ev in eventos_indice:
+                        tp_evento, desc_evento = ev['tp_evento'], ev['descricao'] or ''
+                        dh_evento = ev['dh_evento'] or ev['dh_registro'] or 'N/A'
+                        chave_unica = f"EVENTO_{tp_evento}_{dh_evento}_{desc_evento}"
+                        if chave_unica in eventos_unicos:
+                            continue
+                        eventos_unicos.add(chave_unica)
+                        caminho_ev = ev['caminho']
+                        eventos_encontrados.append({
+                            'arquivo': caminho_solto(caminho_ev).name if caminho_ev else f"Evento {tp_evento}",
+                            'tipo': tipos_eventos_map.get(tp_evento, f"Evento {tp_evento}"),
+                            'descricao': desc_evento,
+                            'data': formatar_data_ev(dh_evento),
+                            'status': f"{ev['c_stat']} - {ev['x_motivo']}",
+                            'caminho': caminho_ev,
+                            'relacao': 'Evento Direto'
+                        })
+                    # Índice ainda em construção: varre a pasta Eventos/ como antes
+                    if not indice_completo and xmls_root.exists():
                         # ⚡ Busca OTIMIZADA: caminho direto (informante/AAMM/Eventos)
                         eventos_folders = []
                         if informante and len(chave) >= 6:
@@ -8053,60 +8599,19 @@ class MainWindow(QMainWindow):
                             except Exception:
                                 pass
                         print(f"[DEBUG] Encontradas {len(eventos_folders)} pastas de Eventos")
-                        tipos_eventos_map = {
-                            '110111': '❌ Cancelamento',
-                            '110110': '✏️ Carta de Correção',
-                            '210200': '📬 Confirmação da Operação',
-                            '210210': '❓ Ciência da Operação',
-                            '210220': '⛔ Desconhecimento da Operação',
-                            '210240': '🚫 Operação não Realizada',
-                            '110140': '🔒 EPEC (Contingência)',
-                            '610130': '🚛 CTe Autorizado', '610131': '🚛 CTe Cancelado',
-                            '610500': '📦 MDFe Autorizado', '610510': '📦 MDFe Cancelado',
-                            '610514': '📦 MDFe com CTe', '610600': '🚛 CTe Vinculado à NFe',
-                            '610601': '🚛 CTe Desvinculado da NFe',
-                            '610610': '📦 MDFe Vinculado à NFe',
-                            '610611': '📦 MDFe Desvinculado da NFe',
-                            '610614': '📦 MDFe Autorizado com CTe',
-                            '610615': '📦 MDFe Cancelado com CTe',
-                            'STATUS': '📋 Status SEFAZ (ConsultaProtocolo)',
-                        }
                         for eventos_folder in eventos_folders:
                             xml_files = list(eventos_folder.glob("*.xml"))
                             if xml_files:
                                 print(f"[DEBUG] Verificando {len(xml_files)} arquivos em {eventos_folder}")
                             for xml_file in xml_files:
                                 try:
-                                    xml_content = xml_file.read_text(encoding='utf-8')
-                                    if chave not in xml_content:
+                                    # Cache por (arquivo, mtime): reabrir a janela não relê nem reparseia a pasta
+                                    ev = evento_do_arquivo(xml_file, chave)
+                                    if ev is None:
                                         continue
                                     print(f"[DEBUG] ✅ Evento encontrado: {xml_file.name}")
-                                    from lxml import etree
-                                    tree = etree.fromstring(xml_content.encode('utf-8'))
-                                    ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-
-                                    # Detecta arquivo de status sintético (gerado pelo "Consultar SEFAZ")
-                                    is_sintetico = tree.tag == 'statusSEFAZ'
-                                    if is_sintetico:
-                                        tp_evento  = tree.findtext('tpEvento') or 'STATUS'
-                                        cstat      = tree.findtext('cStat') or 'N/A'
-                                        xmotivo    = tree.findtext('xMotivo') or 'N/A'
-                                        dh_evento  = tree.findtext('dhRecbto') or 'N/A'
-                                        desc_evento = f"cStat {cstat}: {xmotivo}"
-                                    else:
-                                        tp_evento = tree.findtext('.//nfe:tpEvento', namespaces=ns) or tree.findtext('.//tpEvento') or 'N/A'
-                                        desc_evento = (tree.findtext('.//nfe:descEvento', namespaces=ns)
-                                                       or tree.findtext('.//nfe:xEvento', namespaces=ns)
-                                                       or tree.findtext('.//descEvento')
-                                                       or tree.findtext('.//xEvento') or 'N/A')
-                                        dh_evento = (tree.findtext('.//nfe:dhEvento', namespaces=ns)
-                                                     or tree.findtext('.//nfe:dhRegEvento', namespaces=ns)
-                                                     or tree.findtext('.//nfe:dhRecbto', namespaces=ns)
-                                                     or tree.findtext('.//dhEvento')
-                                                     or tree.findtext('.//dhRegEvento')
-                                                     or tree.findtext('.//dhRecbto') or 'N/A')
-                                        cstat   = tree.findtext('.//nfe:cStat', namespaces=ns) or tree.findtext('.//cStat') or 'N/A'
-                                        xmotivo = tree.findtext('.//nfe:xMotivo', namespaces=ns) or tree.findtext('.//xMotivo') or 'N/A'
+                                    tp_evento, desc_evento, dh_evento = ev['tp_evento'], ev['descricao'], ev['data']
+                                    cstat, xmotivo = ev['cstat'], ev['xmotivo']
                                     evento_desc2 = tipos_eventos_map.get(tp_evento, f"Evento {tp_evento}")
                                     chave_unica = f"EVENTO_{tp_evento}_{dh_evento}_{desc_evento}"
                                     if chave_unica not in eventos_unicos:
@@ -8123,9 +8628,33 @@ class MainWindow(QMainWindow):
                                 except Exception:
                                     continue
 
-                    # 3️⃣ Busca DOCUMENTOS que referenciam este documento
-                    print(f"[DEBUG] 3️⃣ Buscando documentos vinculados...")
-                    if xmls_root.exists():
+                    # 3️⃣ Documentos relacionados (índice doc_links: quem cita esta chave e quem ela cita)
+                    from modules import doc_links
+                    vinculos_completos = False
+                    relacionados = []
+                    try:
+                        with self._db._connect() as _conn_vinc:
+                            vinculos_completos = doc_links.backfill_concluido(_conn_vinc)
+                            relacionados = doc_links.relacionados(_conn_vinc, chave)
+                    except Exception as e:
+                        print(f"[DEBUG] Índice de vínculos indisponível: {e}")
+                    print(f"[DEBUG] 3️⃣ {len(relacionados)} documento(s) relacionado(s) no índice (completo={vinculos_completos})")
+                    for doc in relacionados:
+                        chave_unica = f"VINCULO_{doc['chave']}"
+                        if chave_unica in eventos_unicos:
+                            continue
+                        eventos_unicos.add(chave_unica)
+                        eventos_encontrados.append({
+                            'arquivo': caminho_solto(doc['caminho']).name if doc['caminho'] else doc['chave'],
+                            'tipo': f"🔗 {doc['tipo']} — {doc['descricao']}",
+                            'descricao': f"{doc['tipo']} Nº {doc['numero']} - {doc['emitente'] or 'N/A'}",
+                            'data': formatar_data_ev(doc['data']) if doc['data'] else 'N/A',
+                            'status': f"Chave: {doc['chave']}",
+                            'caminho': doc['caminho'],
+                            'relacao': f"{doc['tipo']} Vinculado"
+                        })
+                    # Índice ainda em construção: procura nos XMLs do informante como antes
+                    if not vinculos_completos and xmls_root.exists():
                         pastas_busca = []
                         if tipo == "NFE":
                             pastas_busca = ["CTe", "MDFe"]
@@ -8164,33 +8693,17 @@ class MainWindow(QMainWindow):
                                             candidatos.extend(_p.glob("*.xml"))
                             for xml_file in candidatos:
                                 try:
-                                    xml_content = xml_file.read_text(encoding='utf-8')
-                                    if chave not in xml_content:
+                                    vinculo = vinculo_do_arquivo(xml_file, chave, pasta_tipo)
+                                    if vinculo is None:
                                         continue
-                                    from lxml import etree
-                                    tree = etree.fromstring(xml_content.encode('utf-8'))
-                                    ns_cte = {'cte': 'http://www.portalfiscal.inf.br/cte'}
-                                    ns_nfe = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                                    ns_mdfe = {'mdfe': 'http://www.portalfiscal.inf.br/mdfe'}
-                                    chave_vinculada = numero_vinculado = emitente_vinculado = data_vinculada = None
-                                    if pasta_tipo == "CTe":
-                                        chave_vinculada = tree.findtext('.//cte:chCTe', namespaces=ns_cte) or tree.findtext('.//chCTe')
-                                        numero_vinculado = tree.findtext('.//cte:nCT', namespaces=ns_cte) or tree.findtext('.//nCT')
-                                        emitente_vinculado = tree.findtext('.//cte:xNome', namespaces=ns_cte) or tree.findtext('.//xNome')
-                                        data_vinculada = tree.findtext('.//cte:dhEmi', namespaces=ns_cte) or tree.findtext('.//dhEmi')
-                                    elif pasta_tipo == "NFe":
-                                        chave_vinculada = tree.findtext('.//nfe:chNFe', namespaces=ns_nfe) or tree.findtext('.//chNFe')
-                                        numero_vinculado = tree.findtext('.//nfe:nNF', namespaces=ns_nfe) or tree.findtext('.//nNF')
-                                        emitente_vinculado = tree.findtext('.//nfe:xNome', namespaces=ns_nfe) or tree.findtext('.//xNome')
-                                        data_vinculada = tree.findtext('.//nfe:dhEmi', namespaces=ns_nfe) or tree.findtext('.//dhEmi')
-                                    elif pasta_tipo == "MDFe":
-                                        chave_vinculada = tree.findtext('.//mdfe:chMDFe', namespaces=ns_mdfe) or tree.findtext('.//chMDFe')
-                                        numero_vinculado = tree.findtext('.//mdfe:nMDF', namespaces=ns_mdfe) or tree.findtext('.//nMDF')
-                                        emitente_vinculado = tree.findtext('.//mdfe:xNome', namespaces=ns_mdfe) or tree.findtext('.//xNome')
-                                        data_vinculada = tree.findtext('.//mdfe:dhEmi', namespaces=ns_mdfe) or tree.findtext('.//dhEmi')
+                                    chave_vinculada = vinculo['chave']
+                                    numero_vinculado = vinculo['numero']
+                                    emitente_vinculado = vinculo['emitente']
+                                    data_vinculada = vinculo['data']
                                     if not numero_vinculado:
                                         numero_vinculado = xml_file.stem[:10]
-                                    chave_unica = f"VINCULO_{chave_vinculada or xml_file.name}_{numero_vinculado}_{data_vinculada}"
+                                    chave_unica = (f"VINCULO_{chave_vinculada}" if chave_vinculada else
+                                                   f"VINCULO_{xml_file.name}_{numero_vinculado}_{data_vinculada}")
                                     if chave_unica not in eventos_unicos:
                                         eventos_unicos.add(chave_unica)
                                         eventos_encontrados.append({
@@ -8573,7 +9086,7 @@ class MainWindow(QMainWindow):
                     
                     # Extrair número e emitente da descrição
                     desc_parts = doc['descricao'].split(' - ', 1)
-                    numero_doc = desc_parts[0].replace('CTe Nº ', '').replace('NFe Nº ', '').replace('MDFe Nº ', '')
+                    numero_doc = desc_parts[0].split(' Nº ', 1)[-1]
                     emitente = desc_parts[1] if len(desc_parts) > 1 else 'N/A'
                     
                     vinculos_table.setItem(i, 1, QTableWidgetItem(numero_doc))
@@ -8600,11 +9113,11 @@ class MainWindow(QMainWindow):
                 tab_vinculos_layout.addWidget(vinculos_table)
                 
                 # Legenda
-                legenda = QLabel("💡 <i>Estes documentos fazem referência à chave de acesso deste documento.</i>")
+                legenda = QLabel("💡 <i>Documentos que citam a chave de acesso deste documento ou são citados por ele.</i>")
                 legenda.setStyleSheet("padding: 5px; color: #666; font-size: 9pt;")
                 tab_vinculos_layout.addWidget(legenda)
                 
-                tabs.addTab(tab_vinculos, f"🔗 Vínculos ({len(documentos_vinculados)})")
+                tabs.addTab(tab_vinculos, f"🔗 Documentos relacionados ({len(documentos_vinculados)})")
             
             layout.addWidget(tabs)
             
@@ -8713,6 +9226,7 @@ class MainWindow(QMainWindow):
                         from lxml import etree as _et
                         from pathlib import Path
                         import re as _re
+                        from modules.eventos_index import indexar_no_banco
 
                         root = _et.fromstring(xml_resp.encode('utf-8') if isinstance(xml_resp, str) else xml_resp)
                         ns_nfe = 'http://www.portalfiscal.inf.br/nfe'
@@ -8730,12 +9244,14 @@ class MainWindow(QMainWindow):
                                 foi_cancelada = True
                             # cStat 217 = "NF-e não consta na base de dados" — MS SEFAZ retorna
                             # esse código para notas canceladas cujo arquivo não está mais disponível.
-                            # Só trata como cancelamento se a nota já está INDISPONIVEL (marcada via cStat=653).
+                            # Só trata como cancelamento se a nota já está INDISPONIVEL (marcada via cStat=653),
+                            # não as que só aguardam nova tentativa de download (resumos_download).
                             if cstat_sefaz == '217' and not foi_cancelada:
                                 try:
                                     with self.db._connect() as _c217:
                                         _row217 = _c217.execute(
-                                            "SELECT xml_status FROM notas_detalhadas WHERE chave=?",
+                                            "SELECT xml_status FROM notas_detalhadas WHERE chave=? AND chave NOT IN "
+                                            "(SELECT chave FROM resumos_download WHERE proxima_tentativa IS NOT NULL)",
                                             (chave,)
                                         ).fetchone()
                                         if _row217 and _row217[0] == 'INDISPONIVEL':
@@ -8777,6 +9293,7 @@ class MainWindow(QMainWindow):
                                         xml_bytes = _et.tostring(ev_el, encoding='utf-8', xml_declaration=True)
                                         caminho_xml.write_bytes(xml_bytes)
                                         eventos_salvos += 1
+                                    indexar_no_banco(self.db.db_path, caminho_xml, cert_cnpj)
                                 except Exception as e_ev:
                                     print(f"[EVENTOS] Erro ao salvar evento individual: {e_ev}")
                     except Exception as e_parse:
@@ -8834,6 +9351,7 @@ class MainWindow(QMainWindow):
                                 )
                                 caminho_xml.write_text(_xml_sintetico, encoding='utf-8')
                                 eventos_salvos += 1
+                                indexar_no_banco(self.db.db_path, caminho_xml, cert_cnpj)
                                 if foi_cancelada:
                                     print(f"[EVENTOS] ❌ Cancelamento confirmado cStat={cstat_sefaz} salvo como evento 110111")
                                 else:
@@ -9588,6 +10106,21 @@ class MainWindow(QMainWindow):
             
             if not sucesso:
                 progress.close()
+                if manifesta_service.falha_de_rede and not (item and item.get('_manual')):
+                    # Sem conexão: guarda na fila offline, reenviada quando a SEFAZ voltar
+                    self.db.enfileirar_requisicao('manifestacao', informante, chave, {
+                        'tipo_evento': tipo_evento,
+                        'cnpj_destinatario': cert_cnpj,
+                        'justificativa': justificativa,
+                    })
+                    QMessageBox.information(
+                        self,
+                        "📴 Sem conexão",
+                        f"Não foi possível falar com a SEFAZ agora:\n\n{mensagem}\n\n"
+                        f"A manifestação foi guardada e será enviada automaticamente "
+                        f"assim que a conexão voltar."
+                    )
+                    return
                 QMessageBox.critical(
                     self,
                     "❌ Erro SEFAZ",
@@ -9628,6 +10161,8 @@ class MainWindow(QMainWindow):
                             _dest_ev_perf.write_text(xml_resposta, encoding='utf-8')
                 except Exception as _pe_ev:
                     print(f"[MANIFESTAÇÃO] Aviso ao salvar evento nos perfis: {_pe_ev}")
+                from modules.eventos_index import indexar_no_banco
+                indexar_no_banco(self.db.db_path, _dest_ev_local, informante)
                 print(f"[MANIFESTAÇÃO] 💾 XML evento salvo: {_dest_ev_local}")
             except Exception as _se_ev:
                 print(f"[MANIFESTAÇÃO] Aviso ao salvar XML do evento: {_se_ev}")
@@ -10163,6 +10698,35 @@ class MainWindow(QMainWindow):
         self._cache_worker.cache_ready.connect(on_cache_ready)
         self._cache_worker.start()
 
+    def _prerenderizar_visiveis(self):
+        """Envia as chaves das linhas na tela para a pré-geração de PDF."""
+        try:
+            if self._table_filling or self.table.rowCount() == 0:
+                return
+            chave_col_index = None
+            for c in range(self.table.columnCount()):
+                header = self.table.horizontalHeaderItem(c)
+                if header and header.text() == "Chave":
+                    chave_col_index = c
+                    break
+            if chave_col_index is None:
+                return
+            primeira = max(self.table.rowAt(0), 0)
+            ultima = self.table.rowAt(self.table.viewport().height() - 1)
+            if ultima < 0:
+                ultima = self.table.rowCount() - 1
+            chaves = []
+            for r in range(primeira, ultima + 1):
+                if self.table.isRowHidden(r):
+                    continue
+                item = self.table.item(r, chave_col_index)
+                if item and item.text().strip():
+                    chaves.append(item.text().strip())
+            from modules.pdf_especulativo import obter_prerenderizador
+            obter_prerenderizador(self.db).visiveis(chaves)
+        except Exception as e:
+            print(f"[PDF-ESPECULATIVO] Erro ao enfileirar linhas visíveis: {e}")
+
     def _on_table_double_clicked(self, row: int, col: int):
         """Abre PDF (verifica existência primeiro, só gera se necessário) - OTIMIZADO"""
         import time
@@ -10749,6 +11313,24 @@ class MainWindow(QMainWindow):
                 self.xml_text_precargado = xml_text_precargado  # XML já resolvido pelo chamador
             
             def run(self):
+                # Pedido interativo: a pré-geração especulativa (modules/pdf_especulativo)
+                # não envia nada novo até terminar; se esta nota já está sendo
+                # pré-gerada, espera por ela em vez de gerar de novo
+                try:
+                    from modules.pdf_especulativo import obter_prerenderizador
+                    prerenderizador = obter_prerenderizador(self.parent_window.db)
+                except Exception:
+                    self._gerar()
+                    return
+                with prerenderizador.interativo():
+                    pronto = prerenderizador.aguardar(self.item.get('chave', ''))
+                    if pronto:
+                        self.status_update.emit("✅ PDF encontrado!")
+                        self.done.emit({"ok": True, "pdf_path": pronto, "pdf_tipo": None})
+                        return
+                    self._gerar()
+            
+            def _gerar(self):
                 try:
                     chave = self.item.get('chave', '')
                     informante = self.item.get('informante', '')
@@ -10831,6 +11413,11 @@ class MainWindow(QMainWindow):
                                 saved_xml_path = str(xml_file)
                                 salvar_xml_por_certificado(xml_text, informante, pasta_base=None, nome_certificado=_nome_cert_dl)
                                 self.parent_window.db.register_xml_download(chave, saved_xml_path, informante)
+                                try:
+                                    from modules.documento_cache import obter_cache_documentos
+                                    obter_cache_documentos().registrar(chave, xml_text, saved_xml_path)
+                                except Exception:
+                                    pass
                                 upd = {'chave': chave, 'xml_status': 'COMPLETO', 'informante': informante}
                                 for k in ['ie_tomador', 'nome_emitente', 'cnpj_emitente', 'numero',
                                           'data_emissao', 'tipo', 'valor', 'cfop', 'vencimento',
@@ -10842,8 +11429,22 @@ class MainWindow(QMainWindow):
                             pass
                     
                     # Determine PDF path - OTIMIZADO para buscar o XML na estrutura organizada
+                    # O cache de documentos já sabe de onde o XML veio (resolve_xml_text
+                    # do duplo clique): PDF ao lado dele, sem varrer a pasta do informante
+                    origem_xml = None
+                    if not saved_xml_path:
+                        try:
+                            from modules.documento_cache import obter_cache_documentos
+                            from modules.arquivo_mensal import caminho_solto
+                            origem_xml = obter_cache_documentos().origem(chave)
+                            if origem_xml:
+                                origem_xml = caminho_solto(origem_xml)
+                        except Exception:
+                            origem_xml = None
                     if saved_xml_path:
                         pdf_path = Path(saved_xml_path).with_suffix('.pdf')
+                    elif origem_xml and origem_xml.parent.is_dir():
+                        pdf_path = origem_xml.with_suffix('.pdf')
                     else:
                         if chave and informante:
                             # Busca o XML APENAS na estrutura organizada por CNPJ (xmls/{CNPJ}/...)
@@ -11615,727 +12216,208 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "Busca por Chave", f"Erro: {e}")
     
     def _executar_busca_por_chaves(self, chaves):
-        """Executa a busca das chaves em background."""
+        """
+        Executa a busca das chaves em background (nfe_search.busca_chaves_lote):
+        chaves já baixadas saem antes de consultar a SEFAZ, cada certificado
+        trabalha na sua fila em paralelo e as notas entram na tabela à medida
+        que chegam. Ao final, as chaves sem documento podem ser salvas num TXT
+        para nova importação.
+        """
         import sys
-        from lxml import etree
         sys.path.insert(0, str(BASE_DIR))
-        from nfe_search import NFeService, XMLProcessor, DatabaseManager, salvar_xml_por_certificado, extrair_nota_detalhada
-        
-        # Cria dialog de progresso
-        progress = QProgressDialog("Buscando chaves na SEFAZ...", "Cancelar", 0, len(chaves), self)
-        progress.setWindowTitle("Busca por Chave")
-        progress.setWindowModality(Qt.WindowModal)
-        progress.setMinimumDuration(0)
-        progress.show()
-        
+        from nfe_search import ESPERA_COOLDOWN_656, DatabaseManager, busca_chaves_lote, sonda_conectividade
+        from modules.busca_chaves_lote import (
+            BLOQUEADO, CANCELADA, ENCONTRADAS, ERRO, JA_BAIXADA, RETENTAVEIS,
+        )
+
+        if getattr(self, '_busca_chaves_worker', None) is not None:
+            QMessageBox.information(self, "Busca por Chave", "Já existe uma busca por chave em andamento.")
+            return
+
         db = DatabaseManager(DB_PATH)
-        parser = XMLProcessor()
-        encontradas = 0
-        nao_encontradas = 0
-        erros = []
-        
-        # Carrega todos os certificados
         certificados = db.get_certificados()
         if not certificados:
             QMessageBox.warning(self, "Busca por Chave", "Nenhum certificado cadastrado!")
             return
-        
-        # Índice do certificado que teve sucesso (para priorizar nos próximos)
-        ultimo_cert_sucesso = 0
-        
-        print(f"\n[BUSCA POR CHAVE] Iniciando busca de {len(chaves)} chaves")
-        print(f"[BUSCA POR CHAVE] Certificados disponíveis: {len(certificados)}")
-        
-        # CNPJs cujo limite de 20 consultas/hora na DistribuiçãoDFe foi atingido (cStat=656).
-        # Persistem para toda a sessão — se um CNPJ foi bloqueado, não adianta tentar nas próximas notas.
-        # Inicializa a partir do cache de instância (compartilhado com _baixar_xml_e_pdf)
+
+        # Sem conexão com a SEFAZ: enfileira as chaves (fila offline) em vez de falhar uma a uma
+        if not sonda_conectividade():
+            for chave in chaves:
+                cert = next((c for c in certificados if c[4] == chave[:2]), certificados[0])
+                db.enfileirar_requisicao('busca_chave', cert[3], chave)
+            QMessageBox.information(
+                self, "📴 Sem conexão",
+                f"A SEFAZ não está acessível agora.\n\n"
+                f"{len(chaves)} chave(s) foram guardadas e serão baixadas automaticamente "
+                f"assim que a conexão voltar."
+            )
+            return
+
+        # CNPJs com limite da DistribuiçãoDFe atingido (656) — cache compartilhado com _baixar_xml_e_pdf
         _agora = datetime.now()
-        _dist_rate_limited_cnpjs_session = {
+        bloqueados_cnpj = {
             cnpj for cnpj, ts in list(self._dist_rl_cache.items())
             if (_agora - ts).total_seconds() < 3600
         }
-        if _dist_rate_limited_cnpjs_session:
-            print(f"[BUSCA POR CHAVE] \u26a0\ufe0f {len(_dist_rate_limited_cnpjs_session)} cert(s) com rate limit ativo: {_dist_rate_limited_cnpjs_session}")
-        
-        for idx, chave in enumerate(chaves):
-            if progress.wasCanceled():
-                print(f"[BUSCA POR CHAVE] Busca cancelada pelo usuário na chave {idx+1}")
-                break
-            
-            print(f"\n{'='*80}")
-            print(f"[BUSCA POR CHAVE] Processando {idx+1}/{len(chaves)}: {chave}")
-            print(f"{'='*80}")
-            
-            progress.setValue(idx)
-            progress.setLabelText(f"Buscando chave {idx+1}/{len(chaves)}...\n{chave}")
-            QApplication.processEvents()
-            
-            resp_xml = None
-            cert_encontrado = None
-            
-            # Detecta tipo do documento pela chave (posição 20-21: modelo)
-            # Modelo 55 = NF-e, Modelo 57 = CT-e
-            modelo = chave[20:22] if len(chave) >= 22 else '55'
-            is_cte = modelo == '57'
-            tipo_doc = 'CT-e' if is_cte else 'NF-e'
-            print(f"[DEBUG] Tipo detectado: {tipo_doc} (modelo={modelo})")
-            
-            # Extrai UF da chave (primeiros 2 dígitos)
-            uf_chave = chave[:2] if len(chave) >= 2 else None
-            print(f"[DEBUG] UF da chave: {uf_chave}")
-            
-            # Ordena certificados: prioriza UF da chave, depois último sucesso, depois resto
-            ordem_certs = []
-            
-            # 1. Certificados da mesma UF da chave
-            for i, cert in enumerate(certificados):
-                if cert[4] == uf_chave:  # cuf == uf_chave
-                    ordem_certs.append(i)
-            
-            # 2. Último certificado com sucesso (se não estiver na lista)
-            if ultimo_cert_sucesso not in ordem_certs:
-                ordem_certs.insert(0, ultimo_cert_sucesso)
-            
-            # 3. Resto dos certificados
-            for i in range(len(certificados)):
-                if i not in ordem_certs:
-                    ordem_certs.append(i)
-            
-            print(f"[DEBUG] Ordem de tentativa dos certificados: {[i+1 for i in ordem_certs]}")
-            
-            _dist_rate_limited_cnpjs = []  # CNPJs bloqueados por rate limit nesta nota (para mensagem de erro)
-
-            # Atalho: se todos os certs estão na sessão de rate limit E nenhum é o emitente desta nota,
-            # não há nada a tentar — pula direto sem entrar no loop de certificados
-            if not is_cte:
-                _cnpj_emit_nota = chave[6:20]
-                _certs_cnpjs = [''.join(c for c in cert[0] if c.isdigit())[-14:] for cert in certificados]
-                _todos_rl = all(cnpj_c in _dist_rate_limited_cnpjs_session for cnpj_c in _certs_cnpjs)
-                if _todos_rl and _cnpj_emit_nota not in _dist_rate_limited_cnpjs_session:
-                    nao_encontradas += 1
-                    _rl_msg = (f"{chave}: Rate limit SEFAZ (656) em todos os {len(certificados)} certificados. "
-                               f"Aguarde ~1 hora e tente novamente.")
-                    erros.append(_rl_msg)
-                    print(f"[DEBUG] Todos os {len(certificados)} certs com rate limit ativo — pulando nota sem HTTP")
-
-                    # Salva chave no banco como RESUMO pendente para o ciclo automático retentar
-                    # quando a quota de 20 consultas/hora renovar (~1h)
-                    try:
-                        with db._connect() as _conn_rl:
-                            _row_rl = _conn_rl.execute(
-                                "SELECT xml_status FROM notas_detalhadas WHERE chave=?", (chave,)
-                            ).fetchone()
-                        if not _row_rl:
-                            # Nota ainda não existe no banco — cria entrada mínima como RESUMO pendente
-                            _inf_rl = certificados[0][3] if certificados else ''
-                            db.salvar_nota_detalhada({
-                                'chave': chave,
-                                'nsu': '',
-                                'informante': _inf_rl,
-                                'xml_status': 'RESUMO',
-                                'tipo': 'NFe',
-                                'numero': '',
-                                'nome_emitente': '',
-                                'ie_tomador': '',
-                                'cnpj_emitente': chave[6:20],
-                                'data_emissao': None,
-                                'valor': None,
-                                'status': '',
-                                'atualizado_em': datetime.now().isoformat(),
-                            })
-                            print(f"[INFO] Chave {chave[:10]}… salva como RESUMO pendente (retry automático em ~1h)")
-                        else:
-                            print(f"[INFO] Chave {chave[:10]}… já existe no banco ({_row_rl[0]}) — não sobrescrevendo")
-                    except Exception as _e_resumo:
-                        print(f"[AVISO] Não foi possível salvar RESUMO pendente para {chave[:10]}…: {_e_resumo}")
 
-                    continue
+        class BuscaChavesWorker(QThread):
+            resultado = pyqtSignal(object)      # ResultadoChave
+            concluido = pyqtSignal(object)      # motor (BuscaChavesLote)
+            erro = pyqtSignal(str)
+
+            def __init__(self):
+                super().__init__()
+                self.motor = None
+                self.cancelar_pedido = False
 
-            for cert_idx in ordem_certs:
+            def run(self):
                 try:
-                    cnpj, path, senha, inf, cuf = certificados[cert_idx]
-                    cnpj = ''.join(c for c in cnpj if c.isdigit())  # normaliza: remove formatação, garante só dígitos
-
-                    # Otimização: se o CNPJ está com rate limit E não é o emitente da chave,
-                    # não há nenhum serviço SEFAZ que possa funcionar — pula sem instanciar NFeService
-                    if not is_cte:
-                        _cnpj_emit_pre = chave[6:20]
-                        if cnpj in _dist_rate_limited_cnpjs_session and cnpj != _cnpj_emit_pre:
-                            print(f"[DEBUG] Cert {cert_idx+1} ({cnpj}): rate limit ativo e não é emitente — pulando sem instanciar serviço")
-                            _dist_rate_limited_cnpjs.append(cnpj)
-                            continue
-                    
-                    print(f"[DEBUG] Tentando certificado {cert_idx+1}/{len(certificados)}: CNPJ={cnpj}, Informante={inf}, UF={cuf}")
-                    
-                    svc = NFeService(path, senha, cnpj, cuf)
-                    
-                    # Busca o XML do documento (NF-e ou CT-e)
-                    if is_cte:
-                        print(f"[DEBUG] Chamando fetch_prot_cte para chave: {chave}")
-                        resp_xml = svc.fetch_prot_cte(chave)
-                    else:
-                        # NF-e: Tenta via DistribuiçãoDFe primeiro (funciona para emitente E destinatário)
-                        # NFeConsultaProtocolo4 (fetch_prot_nfe) retorna cStat 217 para não-emitentes
-                        # Emitente está na própria chave: chave[6:20]
-                        _cnpj_emit_chave = chave[6:20]
-                        if cnpj in _dist_rate_limited_cnpjs_session:
-                            # Quota já esgotada nesta sessão — não adianta tentar
-                            print(f"[DEBUG] CNPJ {cnpj} com rate limit ativo (656), pulando distribuição")
-                            _dist_rate_limited_cnpjs.append(cnpj)
-                            resp_xml = None
-                            continue
-                        print(f"[DEBUG] Tentando NF-e via DistribuiçãoDFe (consChNFe) para: {chave}")
-                        try:
-                            _resp_dist = svc.fetch_by_chave_dist(chave)
-                        except Exception as _e_dist:
-                            print(f"[DEBUG] fetch_by_chave_dist falhou: {_e_dist}")
-                            _resp_dist = None
-                        if _resp_dist and '<cStat>138</cStat>' in _resp_dist:
-                            # Documento localizado via Distribuição (cStat 138)
-                            resp_xml = _resp_dist
-                            print(f"[SUCCESS] NF-e localizada via DistribuiçãoDFe (cStat=138)!")
-                        else:
-                            _cstat_dist = ''
-                            if _resp_dist:
-                                import re as _re
-                                _m = _re.search(r'<cStat>(\d+)</cStat>', _resp_dist)
-                                _cstat_dist = _m.group(1) if _m else '?'
-                            if _cstat_dist == '656':
-                                # Rate limit SEFAZ (20 consultas/hora por CNPJ) — não adianta tentar protocolo
-                                print(f"[AVISO] ⚠️ Distribuição bloqueada por rate limit (656) para CNPJ {cnpj} — pulando protocolo e marcando para sessão")
-                                _dist_rate_limited_cnpjs_session.add(cnpj)  # persiste para toda a sessão
-                                self._dist_rl_cache[cnpj] = datetime.now()  # compartilha com _baixar_xml_e_pdf
-                                _dist_rate_limited_cnpjs.append(cnpj)
-                                resp_xml = None
-                            elif cnpj == _cnpj_emit_chave:
-                                # Este certificado É o emitente da NF-e — protocolo pode funcionar
-                                # (ex: nota ainda não propagada para distribuição)
-                                print(f"[DEBUG] Distribuição: cStat={_cstat_dist or 'N/A'}, cert=emitente → tentando NFeConsultaProtocolo4")
-                                resp_xml = svc.fetch_prot_nfe(chave)
-                            else:
-                                # Cert não é o emitente E distribuição não encontrou → protocolo retornaria 217
-                                print(f"[DEBUG] Distribuição: cStat={_cstat_dist or 'N/A'}, cert≠emitente ({cnpj}≠{_cnpj_emit_chave}) → pulando protocolo")
-                    print(f"[DEBUG] Resposta recebida: {resp_xml[:200] if resp_xml else 'None'}...")
-                    
-                    if resp_xml:
-                        # cStat 138 = NF-e localizada via Distribuição → break imediatamente
-                        if not is_cte and '<cStat>138</cStat>' in resp_xml:
-                            cert_encontrado = (cnpj, path, senha, inf, cuf)
-                            ultimo_cert_sucesso = cert_idx
-                            print(f"[SUCCESS] Certificado {cert_idx+1} encontrou a NF-e via Distribuição!")
-                            break
-                        # Verifica se é erro que indica "tente outro certificado"
-                        # 217 = Nota não consta na base, 226 = UF divergente, 404 = namespace, 137 = não disponível via dist
-                        erros_tentar_outro = ['217', '226', '404', '137']
-                        tem_erro_cert = any(f'<cStat>{cod}</cStat>' in resp_xml for cod in erros_tentar_outro)
-                        
-                        if not tem_erro_cert:
-                            cert_encontrado = (cnpj, path, senha, inf, cuf)
-                            ultimo_cert_sucesso = cert_idx
-                            print(f"[SUCCESS] Nota encontrada com certificado {cert_idx+1}!")
-                            break
-                        else:
-                            # Identifica qual erro
-                            if '<cStat>217</cStat>' in resp_xml:
-                                print(f"[INFO] Nota não consta na base deste certificado (217), tentando próximo...")
-                            elif '<cStat>137</cStat>' in resp_xml:
-                                print(f"[INFO] Documento não disponível via distribuição (137), tentando próximo...")
-                            elif '<cStat>226</cStat>' in resp_xml:
-                                print(f"[INFO] UF divergente (226), tentando próximo...")
-                            elif '<cStat>404</cStat>' in resp_xml:
-                                print(f"[INFO] Erro de namespace (404), tentando próximo...")
-                            else:
-                                print(f"[INFO] Erro ao buscar, tentando próximo certificado...")
-                    
+                    self.motor, resultados = busca_chaves_lote(db, chaves, bloqueados_cnpj=bloqueados_cnpj)
+                    if self.cancelar_pedido:  # cancelado durante a preparação (protocolos de CT-e)
+                        self.motor.cancelar()
+                    for res in resultados:
+                        self.resultado.emit(res)
+                    self.concluido.emit(self.motor)
                 except Exception as e:
-                    print(f"[ERRO] Erro ao tentar certificado {cert_idx+1}: {e}")
                     import traceback
                     traceback.print_exc()
-                    continue
+                    self.erro.emit(str(e))
+
+        progress = QProgressDialog("Buscando chaves na SEFAZ...", "Cancelar", 0, len(chaves), self)
+        progress.setWindowTitle("Busca por Chave")
+        progress.setWindowModality(Qt.NonModal)  # a tabela continua utilizável enquanto as notas chegam
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        progress.show()
+
+        worker = BuscaChavesWorker()
+        self._busca_chaves_worker = worker
+        contagem = {'feitas': 0, 'encontradas': 0}
+        erros = []
+
+        def _on_cancelar():
+            worker.cancelar_pedido = True
+            if worker.motor is not None:
+                worker.motor.cancelar()
+            progress.setLabelText("Cancelando... aguardando as consultas em andamento")
+
+        def _on_resultado(res):
+            contagem['feitas'] += 1
+            if res.encontrada:
+                contagem['encontradas'] += 1
+                if res.situacao != JA_BAIXADA:
+                    self._on_nova_nota_callback(res.dados.get('nota') or res.dados.get('resumo') or {})
+            elif res.situacao != CANCELADA:
+                erros.append(f"{res.chave}: {res.mensagem}")
+            progress.setValue(contagem['feitas'])
+            if not worker.cancelar_pedido:
+                progress.setLabelText(f"Buscando chaves na SEFAZ... {contagem['feitas']}/{len(chaves)}\n"
+                                      f"✅ {contagem['encontradas']} encontrada(s)")
+
+        def _finalizar():
+            self._busca_chaves_worker = None
+            progress.close()
+            if not self._sincronizar_alteracoes():
+                self.refresh_all()
+
+        def _on_erro(msg):
+            _finalizar()
+            QMessageBox.critical(self, "Busca por Chave", f"Erro: {msg}")
+
+        def _on_concluido(motor):
+            for indice in motor.bloqueados:
+                self._dist_rl_cache.setdefault(certificados[indice][0], datetime.now())
+            # 656 e falhas de rede voltam sozinhas pela fila offline
+            for res in motor.resultados.values():
+                if res.situacao in (BLOQUEADO, ERRO):
+                    cert = certificados[res.certificado] if res.certificado is not None else \
+                        next((c for c in certificados if c[4] == res.chave[:2]), certificados[0])
+                    db.enfileirar_requisicao('busca_chave', cert[3], res.chave,
+                                             apos=ESPERA_COOLDOWN_656 if res.situacao == BLOQUEADO else 0)
+            _finalizar()
+
+            situacoes = [r.situacao for r in motor.resultados.values()]
+            ja_baixadas = situacoes.count(JA_BAIXADA)
+            encontradas = sum(1 for s in situacoes if s in ENCONTRADAS) - ja_baixadas
+            retentativa = motor.lista_retentativa(RETENTAVEIS)
+            nao_encontradas = len(motor.lista_retentativa()) - len(retentativa)
+
+            mensagem = "⏹️ Busca cancelada.\n\n" if motor.cancelado else "✅ Busca concluída!\n\n"
+            mensagem += f"📥 Encontradas e salvas: {encontradas}\n"
+            mensagem += f"📁 Já estavam no banco: {ja_baixadas}\n"
+            mensagem += f"❌ Não encontradas: {nao_encontradas}\n"
+            mensagem += f"🔁 Para tentar de novo (656/erro/cancelada): {len(retentativa)}\n"
+            mensagem += f"🌐 Consultas à SEFAZ: {motor.requisicoes}\n\n"
+            mensagem += f"━━━━━━━━━━━━━━━━━━━━━━\n"
+            mensagem += f"📂 Onde encontrar as notas:\n"
+            mensagem += f"  • Notas de SAÍDA → aba 'Saídas'\n"
+            mensagem += f"  • Notas de ENTRADA → aba 'Entradas'\n"
+            mensagem += f"  • XMLs salvos → pasta xmls/ e perfis ativos"
+            if erros and len(erros) <= 10:
+                mensagem += "\n\n⚠️ Erros:\n" + "\n".join(erros[:10])
+            elif erros:
+                mensagem += f"\n\n⚠️ {len(erros)} erros encontrados (veja o log para detalhes)"
+
+            sem_documento = motor.lista_retentativa()
+            if not sem_documento:
+                QMessageBox.information(self, "Busca por Chave - Resultado", mensagem)
+                return
+            mensagem += f"\n\nSalvar as {len(sem_documento)} chave(s) sem documento em um arquivo .txt para importar depois?"
+            if QMessageBox.question(self, "Busca por Chave - Resultado", mensagem,
+                                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No) != QMessageBox.Yes:
+                return
+            arquivo, _ = QFileDialog.getSaveFileName(
+                self, "Salvar chaves para nova tentativa",
+                f"chaves_pendentes_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
+                "Arquivos de texto (*.txt)"
+            )
+            if arquivo:
+                try:
+                    with open(arquivo, 'w', encoding='utf-8') as f:
+                        f.write("\n".join(sem_documento) + "\n")
+                except Exception as e:
+                    QMessageBox.critical(self, "Busca por Chave", f"Erro ao salvar arquivo: {e}")
+
+        progress.canceled.connect(_on_cancelar)
+        worker.resultado.connect(_on_resultado)
+        worker.concluido.connect(_on_concluido)
+        worker.erro.connect(_on_erro)
+        worker.start()
+
+    def _listar_certificados_windows(self):
+        """Lista certificados instalados no Windows (DEPRECADO - usar seleção de .pfx)."""
+        # Função mantida por compatibilidade mas não mais utilizada
+        return []
+    
+    def _selecionar_certificado_pfx(self):
+        """Abre dialog para selecionar arquivo .pfx do certificado."""
+        from PyQt5.QtWidgets import QFileDialog
+        
+        arquivo, _ = QFileDialog.getOpenFileName(
+            self,
+            "Selecione o Certificado Digital",
+            "",
+            "Arquivos de Certificado (*.pfx *.p12);;Todos os Arquivos (*.*)"
+        )
+        
+        if arquivo:
+            self.manifestacao_pfx_path.setText(arquivo)
+            self.manifestacao_pfx_path.setStyleSheet("background-color: #d4edda; border: 2px solid #28a745;")
+
+    def abrir_manifestacao(self):
+        """Lista certificados instalados no Windows Certificate Store."""
+        certificados = []
+        
+        try:
+            import sys
+            if sys.platform != 'win32':
+                print("[CERTIFICADOS] Sistema não é Windows")
+                return certificados
+            
+            print("\n[CERTIFICADOS] Iniciando listagem de certificados do Windows...")
             
-            # Processa resultado
-            try:
-                if not resp_xml or not cert_encontrado:
-                    nao_encontradas += 1
-                    if _dist_rate_limited_cnpjs:
-                        # Normaliza CNPJs (remove duplicatas, garante 14 dígitos)
-                        _cnpjs_rl_uniq = list(dict.fromkeys(
-                            ''.join(c for c in c2 if c.isdigit()) for c2 in _dist_rate_limited_cnpjs
-                        ))
-                        _rl_msg = (f"{chave}: Rate limit SEFAZ/Distribuição (656) para "
-                                   f"{len(_cnpjs_rl_uniq)} certificado(s) — "
-                                   f"{', '.join(_cnpjs_rl_uniq)}. "
-                                   f"Aguarde ~1 hora e tente novamente.")
-                        erros.append(_rl_msg)
-                        print(f"[ERRO] ⚠️ {_rl_msg}")
-
-                        # Salva como RESUMO pendente para retry automático
-                        try:
-                            with db._connect() as _conn_rl2:
-                                _row_rl2 = _conn_rl2.execute(
-                                    "SELECT xml_status FROM notas_detalhadas WHERE chave=?", (chave,)
-                                ).fetchone()
-                            if not _row_rl2:
-                                _inf_rl = certificados[0][3] if certificados else ''
-                                db.salvar_nota_detalhada({
-                                    'chave': chave,
-                                    'nsu': '',
-                                    'informante': _inf_rl,
-                                    'xml_status': 'RESUMO',
-                                    'tipo': 'NFe',
-                                    'numero': '',
-                                    'nome_emitente': '',
-                                    'ie_tomador': '',
-                                    'cnpj_emitente': chave[6:20],
-                                    'data_emissao': None,
-                                    'valor': None,
-                                    'status': '',
-                                    'atualizado_em': datetime.now().isoformat(),
-                                })
-                                print(f"[INFO] Chave {chave[:10]}… salva como RESUMO pendente (retry automático em ~1h)")
-                            else:
-                                print(f"[INFO] Chave {chave[:10]}… já existe no banco ({_row_rl2[0]}) — não sobrescrevendo")
-                        except Exception as _e_resumo2:
-                            print(f"[AVISO] Não foi possível salvar RESUMO pendente: {_e_resumo2}")
-                    else:
-                        erros.append(f"{chave}: Não encontrada em nenhum certificado")
-                        print(f"[ERRO] Chave não encontrada em nenhum certificado")
-                    continue
-                
-                if resp_xml:
-                    print(f"[DEBUG] Processando resposta XML...")
-                    
-                    # 🆕 Resposta da DistribuiçãoDFe (retDistDFeInt com docZip)?
-                    # Isso acontece quando a NF-e foi encontrada via consChNFe (emitente ou destinatário)
-                    if not is_cte and ('<retDistDFeInt' in resp_xml or (
-                            '<cStat>138</cStat>' in resp_xml and '<docZip' in resp_xml)):
-                        print(f"[DEBUG] Resposta da DistribuiçãoDFe — extraindo XML do docZip...")
-                        import base64, gzip
-                        xml_completo = None
-                        try:
-                            _root_d = etree.fromstring(resp_xml.encode('utf-8') if isinstance(resp_xml, str) else resp_xml)
-                            _ns_d = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                            for dz in (_root_d.findall('.//nfe:docZip', namespaces=_ns_d) + _root_d.findall('.//docZip')):
-                                if dz.text:
-                                    try:
-                                        _xml_b = gzip.decompress(base64.b64decode(dz.text)).decode('utf-8')
-                                        if '<nfeProc' in _xml_b or '<NFe' in _xml_b or '<procNFe' in _xml_b:
-                                            xml_completo = _xml_b
-                                            print(f"[DEBUG] XML extraído do docZip: {len(xml_completo)} bytes")
-                                            break
-                                    except Exception as _e_unzip:
-                                        print(f"[DEBUG] Erro ao descompactar docZip: {_e_unzip}")
-                        except Exception as _e_parse_dist:
-                            print(f"[DEBUG] Erro ao parsear resposta de distribuição: {_e_parse_dist}")
-                        
-                        if not xml_completo:
-                            nao_encontradas += 1
-                            erros.append(f"{chave}: Distribuição retornou 138 mas sem XML válido no docZip")
-                            continue
-                        
-                        cnpj_cert, _, _, inf_correto, _ = cert_encontrado
-                        nome_cert = db.get_cert_nome_by_informante(inf_correto)
-                        
-                        resultado_local = salvar_xml_por_certificado(xml_completo, cnpj_cert, pasta_base="xmls")
-                        caminho_xml = resultado_local[0] if isinstance(resultado_local, tuple) else resultado_local
-                        salvar_xml_por_certificado(xml_completo, cnpj_cert, pasta_base=None, nome_certificado=nome_cert)
-                        
-                        if caminho_xml:
-                            db.registrar_xml(chave, inf_correto, caminho_xml)
-                        else:
-                            db.registrar_xml(chave, inf_correto)
-                        
-                        encontradas += 1
-                        print(f"[SUCCESS] NF-e via Distribuição registrada! ({len(xml_completo)} bytes)")
-                        
-                        try:
-                            print(f"[DEBUG] Extraindo dados completos da NF-e...")
-                            from nfe_search import XMLProcessor
-                            nota_dados = extrair_nota_detalhada(
-                                xml_completo,
-                                XMLProcessor(),
-                                db,
-                                chave,
-                                informante=inf_correto,
-                                nsu_documento=""
-                            )
-                            db.salvar_nota_detalhada(nota_dados)
-                            
-                            certs_cnpjs = [c[0] for c in certificados]
-                            cnpj_emit = nota_dados.get('cnpj_emitente', '')
-                            cnpj_emit_limpo = ''.join(c for c in cnpj_emit if c.isdigit())
-                            if cnpj_emit_limpo in certs_cnpjs:
-                                print(f"[INFO] ✅ NF-e de SAÍDA (emitente = certificado)")
-                            else:
-                                print(f"[INFO] ✅ NF-e de ENTRADA (emitente ≠ certificado)")
-                        except Exception as _e_extract_dist:
-                            print(f"[AVISO] Erro ao extrair dados: {_e_extract_dist}")
-                        
-                        continue  # Processamento via distribuição concluído, próxima nota
-                    
-                    # Parse da resposta (protocolo NF-e ou CT-e)
-                    try:
-                        tree = etree.fromstring(resp_xml.encode('utf-8') if isinstance(resp_xml, str) else resp_xml)
-                        print(f"[DEBUG] XML parseado com sucesso")
-                        
-                        # Extrai informações do protocolo (NF-e ou CT-e)
-                        if is_cte:
-                            # Namespace CT-e
-                            NS = {'cte': 'http://www.portalfiscal.inf.br/cte'}
-                            prot = tree.find('.//cte:protCTe', namespaces=NS)
-                            print(f"[DEBUG] protCTe encontrado: {prot is not None}")
-                            
-                            if prot is not None:
-                                ch = prot.findtext('cte:infProt/cte:chCTe', namespaces=NS) or ''
-                                cStat = prot.findtext('cte:infProt/cte:cStat', namespaces=NS) or ''
-                                xMotivo = prot.findtext('cte:infProt/cte:xMotivo', namespaces=NS) or ''
-                                print(f"[DEBUG] Protocolo CT-e: chave={ch}, cStat={cStat}, xMotivo={xMotivo}")
-                                
-                                # Salva status
-                                if ch and cStat:
-                                    db.set_nf_status(ch, cStat, xMotivo)
-                                    print(f"[DEBUG] Status CT-e salvo no banco")
-                                
-                                # Se autorizado (código 100 = Autorizado)
-                                if cStat in ['100', '101', '110', '150', '301', '302']:
-                                    cnpj_cert, _, _, inf_correto, _ = cert_encontrado
-                                    
-                                    import base64, gzip
-                                    xml_completo = None
-                                    
-                                    # ── TIER 1: O retConsSitCTe de algumas SEFAZ já embute o XML completo ──
-                                    print(f"[DEBUG] Tier 1: verificando CT-e embutido no protocolo ({len(resp_xml)} bytes)...")
-                                    try:
-                                        NS_CTE = {'cte': 'http://www.portalfiscal.inf.br/cte'}
-                                        cte_elem = tree.find('.//cte:CTe', namespaces=NS_CTE)
-                                        prot_elem = tree.find('.//cte:protCTe', namespaces=NS_CTE)
-                                        if cte_elem is not None:
-                                            cte_str = etree.tostring(cte_elem, encoding='unicode')
-                                            prot_str = etree.tostring(prot_elem, encoding='unicode') if prot_elem is not None else ''
-                                            xml_completo = (
-                                                '<cteProc versao="4.00" xmlns="http://www.portalfiscal.inf.br/cte">'
-                                                + cte_str + prot_str + '</cteProc>'
-                                            )
-                                            print(f"[DEBUG] Tier 1: CT-e extraído do protocolo ({len(xml_completo)} bytes)")
-                                    except Exception as e_t1:
-                                        print(f"[DEBUG] Tier 1 falhou: {e_t1}")
-                                    
-                                    # ── TIER 2: CTeDistribuicaoDFe (serviço correto para CT-e por chave) ──
-                                    if not xml_completo:
-                                        print(f"[DEBUG] Tier 2: buscando CT-e via CTeDistribuicaoDFe...")
-                                        try:
-                                            from modules.cte_service import CTeService
-                                            _, path_c, senha_c, _, cuf_c = cert_encontrado
-                                            cte_svc = CTeService(path_c, senha_c, cnpj_cert, cuf_c, ambiente='producao')
-                                            # Tenta via NSU de distribuição usando consChNFe (que serve CT-e também)
-                                            resp_dist_cte = svc.fetch_by_chave_dist(chave)
-                                            if resp_dist_cte:
-                                                if '<cteProc' in resp_dist_cte or '<CTe' in resp_dist_cte:
-                                                    xml_completo = resp_dist_cte
-                                                else:
-                                                    _root_d = etree.fromstring(resp_dist_cte.encode('utf-8') if isinstance(resp_dist_cte, str) else resp_dist_cte)
-                                                    _ns_d = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                                                    for dz in (_root_d.findall('.//nfe:docZip', namespaces=_ns_d) + _root_d.findall('.//docZip')):
-                                                        if dz.text:
-                                                            _xml_b = gzip.decompress(base64.b64decode(dz.text)).decode('utf-8')
-                                                            if '<cteProc' in _xml_b or '<CTe' in _xml_b:
-                                                                xml_completo = _xml_b
-                                                                break
-                                            if xml_completo:
-                                                print(f"[DEBUG] Tier 2: CT-e obtido via distribuição ({len(xml_completo)} bytes)")
-                                        except Exception as e_t2:
-                                            print(f"[DEBUG] Tier 2 falhou: {e_t2}")
-                                    
-                                    # ── TIER 3 (fallback crítico): salva como RESUMO a partir dos dados do protocolo ──
-                                    # Garante que o CT-e autorizado SEMPRE aparece na interface.
-                                    if not xml_completo:
-                                        print(f"[AVISO] XML completo CT-e indisponível — salvando como RESUMO a partir do protocolo")
-                                        try:
-                                            # Extrai campos da chave (padrão SEFAZ: cUF|AAMM|CNPJ|mod|serie|nDoc|...)
-                                            numero_cte = str(int(chave[25:34]))
-                                            aamm = chave[2:6]
-                                            data_est = f"20{aamm[:2]}-{aamm[2:4]}-01"
-                                            cnpj_emit_chave = chave[6:20]
-                                            # Tenta obter nome do emitente via protocolo se disponível
-                                            nome_emit = ''
-                                            try:
-                                                _xe = tree.find('.//cte:xNome', namespaces={'cte': 'http://www.portalfiscal.inf.br/cte'})
-                                                if _xe is not None:
-                                                    nome_emit = _xe.text or ''
-                                            except Exception:
-                                                pass
-                                            nota_resumo = {
-                                                'chave': chave,
-                                                'tipo': 'CTe',
-                                                'numero': numero_cte,
-                                                'data_emissao': data_est,
-                                                'cnpj_emitente': cnpj_emit_chave,
-                                                'nome_emitente': nome_emit,
-                                                'informante': inf_correto,
-                                                'status': xMotivo,
-                                                'xml_status': 'RESUMO',
-                                                'valor': '',
-                                                'nome_destinatario': '',
-                                                'cnpj_destinatario': '',
-                                                'uf': chave[:2],
-                                                'nsu': '',
-                                                'ie_tomador': '',
-                                                'atualizado_em': __import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                                                'cfop': '',
-                                                'vencimento': '',
-                                                'ncm': '',
-                                                'natureza': '',
-                                                'base_icms': '',
-                                                'valor_icms': '',
-                                                'v_ibs': '',
-                                                'v_cbs': '',
-                                            }
-                                            db.salvar_nota_detalhada(nota_resumo)
-                                            encontradas += 1
-                                            print(f"[SUCCESS] CT-e salvo como RESUMO (Tier 3): chave={chave}")
-                                        except Exception as e_t3:
-                                            print(f"[ERRO] Tier 3 falhou: {e_t3}")
-                                            nao_encontradas += 1
-                                            erros.append(f"{chave}: autorizado ({cStat}) mas XML indisponível e RESUMO falhou: {e_t3}")
-                                        continue  # Pula o bloco de armazenamento completo abaixo
-                                    
-                                    # 🆕 ARMAZENAMENTO AUTOMÁTICO: Salva em backup local (xmls/) + TODOS os perfis ativos
-                                    nome_cert = db.get_cert_nome_by_informante(inf_correto)
-                                    
-                                    # Salva em backup local (xmls/)
-                                    resultado_local = salvar_xml_por_certificado(xml_completo, cnpj_cert, pasta_base="xmls")
-                                    caminho_xml = resultado_local[0] if isinstance(resultado_local, tuple) else resultado_local
-                                    
-                                    # Salva em TODOS os perfis ativos configurados (pasta_base=None)
-                                    salvar_xml_por_certificado(xml_completo, cnpj_cert, pasta_base=None, nome_certificado=nome_cert)
-                                    
-                                    # Registra no banco COM o caminho
-                                    if caminho_xml:
-                                        db.registrar_xml(chave, inf_correto, caminho_xml)
-                                    else:
-                                        db.registrar_xml(chave, inf_correto)
-                                    
-                                    encontradas += 1
-                                    print(f"[SUCCESS] CT-e autorizado e registrado com certificado {inf_correto}!")
-                                    
-                                    # Processa e salva dados detalhados do CT-e
-                                    try:
-                                        extrair_nota_detalhada(xml_completo, parser, db, chave, inf_correto)
-                                        print(f"[DEBUG] Dados detalhados do CT-e salvos no banco")
-                                    except Exception as e_extract:
-                                        print(f"[AVISO] Erro ao extrair dados detalhados do CT-e: {e_extract}")
-                                else:
-                                    nao_encontradas += 1
-                                    erros.append(f"{chave}: {cStat} - {xMotivo}")
-                                    print(f"[ERRO] CT-e não autorizado: {cStat} - {xMotivo}")
-                            else:
-                                # Tenta extrair erro da consulta
-                                cStat = tree.findtext('.//cte:cStat', namespaces=NS) or ''
-                                xMotivo = tree.findtext('.//cte:xMotivo', namespaces=NS) or 'Protocolo CT-e não encontrado'
-                                print(f"[ERRO] protCTe não encontrado. cStat={cStat}, xMotivo={xMotivo}")
-                                nao_encontradas += 1
-                                erros.append(f"{chave}: {cStat} - {xMotivo}")
-                        else:
-                            # Namespace NF-e
-                            NS = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                            prot = tree.find('.//nfe:protNFe', namespaces=NS)
-                            print(f"[DEBUG] protNFe encontrado: {prot is not None}")
-                            
-                            if prot is not None:
-                                ch = prot.findtext('nfe:infProt/nfe:chNFe', namespaces=NS) or ''
-                                cStat = prot.findtext('nfe:infProt/nfe:cStat', namespaces=NS) or ''
-                                xMotivo = prot.findtext('nfe:infProt/nfe:xMotivo', namespaces=NS) or ''
-                                print(f"[DEBUG] Protocolo: chave={ch}, cStat={cStat}, xMotivo={xMotivo}")
-                                
-                                # Salva status
-                                if ch and cStat:
-                                    db.set_nf_status(ch, cStat, xMotivo)
-                                    print(f"[DEBUG] Status salvo no banco")
-                                
-                                # Se autorizada
-                                if cStat in ['100', '101', '110', '150', '301', '302']:
-                                    cnpj_cert, _, _, inf_correto, _ = cert_encontrado
-                                    
-                                    # ⚠️ fetch_prot_nfe retorna apenas protocolo (retConsSitNFe),
-                                    # não o XML completo da NF-e. É preciso buscá-lo via DistribuiçãoDFe.
-                                    xml_completo = None
-                                    print(f"[DEBUG] Buscando XML completo da NF-e via DistribuiçãoDFe...")
-                                    try:
-                                        import base64, gzip
-                                        resp_dist = svc.fetch_by_chave_dist(chave)
-                                        if resp_dist:
-                                            if '<nfeProc' in resp_dist or '<procNFe' in resp_dist:
-                                                xml_completo = resp_dist
-                                            else:
-                                                # Tenta descompactar docZip
-                                                _root_d = etree.fromstring(resp_dist.encode('utf-8'))
-                                                _ns_d = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                                                for dz in (_root_d.findall('.//nfe:docZip', namespaces=_ns_d) + _root_d.findall('.//docZip')):
-                                                    if dz.text:
-                                                        _xml_b = gzip.decompress(base64.b64decode(dz.text)).decode('utf-8')
-                                                        if '<nfeProc' in _xml_b or '<procNFe' in _xml_b:
-                                                            xml_completo = _xml_b
-                                                            break
-                                    except Exception as e_dist:
-                                        print(f"[AVISO] Erro ao buscar NF-e completa via distribuição: {e_dist}")
-                                    
-                                    if not xml_completo:
-                                        print(f"[AVISO] XML completo NF-e não disponível ainda na DistribuiçãoDFe")
-                                        nao_encontradas += 1
-                                        erros.append(f"{chave}: autorizado ({cStat}) mas XML completo não disponível")
-                                        continue
-                                    
-                                    # 🆕 ARMAZENAMENTO AUTOMÁTICO: Salva em backup local (xmls/) + TODOS os perfis ativos
-                                    nome_cert = db.get_cert_nome_by_informante(inf_correto)
-                                    
-                                    # Salva em backup local (xmls/)
-                                    resultado_local = salvar_xml_por_certificado(xml_completo, cnpj_cert, pasta_base="xmls")
-                                    caminho_xml = resultado_local[0] if isinstance(resultado_local, tuple) else resultado_local
-                                    
-                                    # Salva em TODOS os perfis ativos configurados (pasta_base=None)
-                                    salvar_xml_por_certificado(xml_completo, cnpj_cert, pasta_base=None, nome_certificado=nome_cert)
-                                    
-                                    # Registra no banco COM o caminho
-                                    if caminho_xml:
-                                        db.registrar_xml(chave, inf_correto, caminho_xml)
-                                    else:
-                                        db.registrar_xml(chave, inf_correto)
-                                    
-                                    encontradas += 1
-                                    print(f"[SUCCESS] Nota autorizada e registrada com certificado {inf_correto}!")
-                                    
-                                    # 🆕 EXTRAÇÃO COMPLETA DE DADOS (tanto de entrada quanto saída)
-                                    try:
-                                        print(f"[DEBUG] Extraindo dados completos da NF-e...")
-                                        from nfe_search import XMLProcessor
-                                        nota_dados = extrair_nota_detalhada(
-                                            xml_completo,
-                                            XMLProcessor(),
-                                            db,
-                                            chave,
-                                            informante=inf_correto,
-                                            nsu_documento=""  # Notas consultadas por chave não têm NSU
-                                        )
-                                        
-                                        # Salva dados completos no banco
-                                        db.salvar_nota_detalhada(nota_dados)
-                                        
-                                        # Mostra informações extraídas
-                                        num = nota_dados.get('numero', 'N/A')
-                                        emit = nota_dados.get('nome_emitente', 'N/A')
-                                        cnpj_emit = nota_dados.get('cnpj_emitente', 'N/A')
-                                        valor = nota_dados.get('valor', 'N/A')
-                                        data = nota_dados.get('data_emissao', 'N/A')
-                                        
-                                        print(f"[DEBUG] Dados completos salvos:")
-                                        print(f"  • Número: {num}")
-                                        print(f"  • Emitente: {emit} (CNPJ: {cnpj_emit})")
-                                        print(f"  • Valor: R$ {valor}")
-                                        print(f"  • Data: {data}")
-                                        print(f"  • Status: COMPLETO (XML salvo)")
-                                        
-                                        # 🎯 IDENTIFICA SE É DE SAÍDA OU ENTRADA
-                                        # Verifica se o emitente é um dos certificados cadastrados
-                                        certs_cnpjs = [c[0] for c in certificados]  # Lista de CNPJs dos certificados
-                                        cnpj_emit_limpo = ''.join(c for c in cnpj_emit if c.isdigit())
-                                        
-                                        if cnpj_emit_limpo in certs_cnpjs:
-                                            print(f"[INFO] ✅ NF-e de SAÍDA detectada (emitente = certificado)")
-                                            print(f"[INFO] 📂 Aparecerá na aba 'Emitidos pela empresa'")
-                                        else:
-                                            print(f"[INFO] ✅ NF-e de ENTRADA detectada (emitente ≠ certificado)")
-                                            print(f"[INFO] 📂 Aparecerá na aba principal")
-                                        
-                                    except Exception as e_extract:
-                                        print(f"[AVISO] Erro ao extrair dados completos da NF-e: {e_extract}")
-                                        import traceback
-                                        traceback.print_exc()
-                                else:
-                                    nao_encontradas += 1
-                                    erros.append(f"{chave}: {cStat} - {xMotivo}")
-                                    print(f"[ERRO] Nota não autorizada: {cStat} - {xMotivo}")
-                            else:
-                                # Tenta extrair erro da consulta
-                                cStat = tree.findtext('.//nfe:cStat', namespaces=NS) or ''
-                                xMotivo = tree.findtext('.//nfe:xMotivo', namespaces=NS) or 'Protocolo não encontrado'
-                                print(f"[ERRO] protNFe não encontrado. cStat={cStat}, xMotivo={xMotivo}")
-                                nao_encontradas += 1
-                                erros.append(f"{chave}: {cStat} - {xMotivo}")
-                    
-                    except Exception as e:
-                        print(f"[EXCEPTION] Erro ao processar XML: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        nao_encontradas += 1
-                        erros.append(f"{chave}: Erro ao processar XML - {str(e)}")
-                else:
-                    nao_encontradas += 1
-                    erros.append(f"{chave}: Falha na comunicação")
-                    
-            except Exception as e:
-                nao_encontradas += 1
-                erros.append(f"{chave}: {str(e)}")
-        
-        print(f"\n[BUSCA POR CHAVE] Loop finalizado")
-        print(f"[BUSCA POR CHAVE] Encontradas: {encontradas}, Não encontradas: {nao_encontradas}")
-        print(f"[BUSCA POR CHAVE] Total processado: {encontradas + nao_encontradas} de {len(chaves)}")
-        
-        progress.setValue(len(chaves))
-        
-        # Atualiza tabela
-        self.refresh_all()
-        
-        # Mostra resultado
-        mensagem = f"✅ Busca concluída!\n\n"
-        mensagem += f"📥 Encontradas e salvas: {encontradas}\n"
-        mensagem += f"❌ Não encontradas/erro: {nao_encontradas}\n"
-        mensagem += f"📊 Total processado: {encontradas + nao_encontradas} de {len(chaves)} chaves\n\n"
-        mensagem += f"━━━━━━━━━━━━━━━━━━━━━━\n"
-        mensagem += f"📂 Onde encontrar as notas:\n"
-        mensagem += f"  • Notas de SAÍDA → aba 'Saídas'\n"
-        mensagem += f"  • Notas de ENTRADA → aba 'Entradas'\n"
-        mensagem += f"  • XMLs salvos → pasta xmls/ e perfis ativos"
-        
-        if erros and len(erros) <= 10:
-            mensagem += "\n\n⚠️ Erros:\n" + "\n".join(erros[:10])
-        elif erros:
-            mensagem += f"\n\n⚠️ {len(erros)} erros encontrados (veja o log para detalhes)"
-        
-        QMessageBox.information(self, "Busca por Chave - Resultado", mensagem)
-
-    def _listar_certificados_windows(self):
-        """Lista certificados instalados no Windows (DEPRECADO - usar seleção de .pfx)."""
-        # Função mantida por compatibilidade mas não mais utilizada
-        return []
-    
-    def _selecionar_certificado_pfx(self):
-        """Abre dialog para selecionar arquivo .pfx do certificado."""
-        from PyQt5.QtWidgets import QFileDialog
-        
-        arquivo, _ = QFileDialog.getOpenFileName(
-            self,
-            "Selecione o Certificado Digital",
-            "",
-            "Arquivos de Certificado (*.pfx *.p12);;Todos os Arquivos (*.*)"
-        )
-        
-        if arquivo:
-            self.manifestacao_pfx_path.setText(arquivo)
-            self.manifestacao_pfx_path.setStyleSheet("background-color: #d4edda; border: 2px solid #28a745;")
-
-    def abrir_manifestacao(self):
-        """Lista certificados instalados no Windows Certificate Store."""
-        certificados = []
-        
-        try:
-            import sys
-            if sys.platform != 'win32':
-                print("[CERTIFICADOS] Sistema não é Windows")
-                return certificados
-            
-            print("\n[CERTIFICADOS] Iniciando listagem de certificados do Windows...")
-            
-            # Tenta usar wincertstore + cryptography
+            # Tenta usar wincertstore + cryptography
             try:
                 import wincertstore
                 from cryptography import x509
@@ -13144,6 +13226,8 @@ class MainWindow(QMainWindow):
                             _dest_ev_perf.write_text(xml_resposta, encoding='utf-8')
                 except Exception as _pe_ev:
                     print(f"[MANIFESTAÇÃO] Aviso ao salvar evento nos perfis: {_pe_ev}")
+                from modules.eventos_index import indexar_no_banco
+                indexar_no_banco(self.db.db_path, _dest_ev_local, informante)
                 print(f"[MANIFESTAÇÃO] 💾 XML evento salvo: {_dest_ev_local}")
             except Exception as _se_ev:
                 print(f"[MANIFESTAÇÃO] Aviso ao salvar XML do evento: {_se_ev}")
@@ -13866,18 +13950,29 @@ class MainWindow(QMainWindow):
                     # Indexa na tabela de campos completos (nfe_docs / cte_docs / nfse_docs / nfce_docs)
                     try:
                         from modules.xml_indexer import parse_nfe, parse_cte, parse_nfse, parse_nfse_abrasf, parse_nfce
+                        from modules.doc_links import registrar_dados
+                        from modules import nfe_itens
                         if tipo == 'NFe':
                             idx = parse_nfe(str(dest_file), informante=informante)
                             if idx.get('chave'):
                                 self.db.upsert_nfe_doc(idx)
+                                with self.db._connect() as conn:
+                                    registrar_dados(conn, idx)
+                                    if nfe_itens.ativo(conn):
+                                        nfe_itens.indexar_arquivo(conn, dest_file, idx['chave'])
                         elif tipo == 'NFCe':
                             idx = parse_nfce(str(dest_file), informante=informante)
                             if idx.get('chave'):
                                 self.db.upsert_nfce_doc(idx)
+                                with self.db._connect() as conn:
+                                    if nfe_itens.ativo(conn):
+                                        nfe_itens.indexar_arquivo(conn, dest_file, idx['chave'])
                         elif tipo == 'CTe':
                             idx = parse_cte(str(dest_file), informante=informante)
                             if idx.get('chave'):
                                 self.db.upsert_cte_doc(idx)
+                                with self.db._connect() as conn:
+                                    registrar_dados(conn, idx)
                         elif tipo in ('NFS-e', 'NFSe', 'NFSE'):
                             # Detect ABRASF vs SPED/ADN
                             header_bytes = Path(dest_file).read_bytes()[:512].decode('utf-8', errors='ignore')
@@ -13955,225 +14050,134 @@ class MainWindow(QMainWindow):
             traceback.print_exc()
     
     def _executar_exportacao(self, opcoes, tabela=None):
-        """Executa a exportação com as opções selecionadas."""
-        from datetime import datetime
-        import shutil
-        
+        """
+        Executa a exportação com as opções selecionadas em segundo plano
+        (modules/exportacao_lote): caminhos resolvidos em lote no banco,
+        leitura em paralelo e gravação direto na pasta ou num .zip único.
+        """
         # Usa a tabela passada como parâmetro; cai na tabela recebidas por compatibilidade
         if tabela is None:
             tabela = self.table
-        
+
         try:
-            print("\n" + "="*60)
-            print("🔍 INICIANDO EXPORTAÇÃO - DEBUG")
-            print("="*60)
-            print(f"Opções selecionadas: {opcoes}")
-            
-            # Seleciona pasta de destino
-            pasta_destino = QFileDialog.getExistingDirectory(
-                self,
-                "Selecionar pasta de destino para exportação"
+            from modules.exportacao_lote import (
+                DestinoPasta, DestinoZip, ExportadorLote, localizar_em_lote,
             )
-            
-            if not pasta_destino:
-                print("❌ Usuário cancelou seleção de pasta")
-                return
-            
-            pasta_destino = Path(pasta_destino)
-            print(f"📁 Pasta destino: {pasta_destino}")
-            
-            # Obtém documentos selecionados
-            selected_rows = tabela.selectionModel().selectedRows()
-            total = len(selected_rows)
-            print(f"📋 Total de documentos selecionados: {total}")
-            
-            # Progress dialog
-            progress = QProgressDialog("Exportando arquivos...", "Cancelar", 0, total, self)
-            progress.setWindowTitle("Exportar")
-            progress.setWindowModality(Qt.WindowModal)
-            progress.show()
-            
-            exportados = 0
-            pulados = 0  # NFSe sem arquivos disponíveis
-            erros = []
-            
-            for idx, row_index in enumerate(selected_rows):
-                if progress.wasCanceled():
-                    print("⚠️ Exportação cancelada pelo usuário")
+
+            print(f"\n[EXPORTAR] Opções selecionadas: {opcoes}")
+
+            # Coluna "Chave" pelo cabeçalho (recebidos e emitidos têm posições diferentes)
+            chave_col_index = None
+            for col in range(tabela.columnCount()):
+                header_item = tabela.horizontalHeaderItem(col)
+                if header_item and header_item.text() == "Chave":
+                    chave_col_index = col
                     break
-                
-                row = row_index.row()
-                # Coluna 18 é "Chave" (última coluna do header)
-                # Headers: XML(0), Num(1), D/Emit(2), Tipo(3), Valor(4), Venc(5), 
-                #          Emissor CNPJ(6), Emissor Nome(7), Natureza(8), UF(9), 
-                #          Base ICMS(10), Valor ICMS(11), IBS(12), CBS(13), 
-                #          Status(14), CFOP(15), NCM(16), Tomador IE(17), Chave(18)
-                chave = tabela.item(row, 18).text() if tabela.item(row, 18) else None
-                
-                if not chave:
-                    print(f"⚠️ Linha {row}: Chave não encontrada na tabela")
-                    continue
-                
-                print(f"\n📄 [{idx+1}/{total}] Processando chave: {chave}")
-                
-                progress.setLabelText(f"Exportando {idx+1}/{total}...")
-                progress.setValue(idx)
-                
-                try:
-                    # Busca informações do documento no banco
-                    print(f"  🔍 Buscando documento no banco...")
-                    doc = self.db.get_documento_por_chave(chave)
-                    
-                    if not doc:
-                        erro_msg = f"Documento não encontrado no banco: {chave}"
-                        print(f"  ❌ {erro_msg}")
-                        erros.append(erro_msg)
-                        continue
-                    
-                    print(f"  ✅ Documento encontrado: Número={doc.get('numero')}, Emitente={doc.get('nome_emitente')}")
-                    
-                    # Define nome do arquivo
-                    if opcoes['nome_personalizado']:
-                        # Usa número e nome do documento
-                        numero = doc.get('numero', 'SN')
-                        nome_emit = doc.get('nome_emitente', 'Desconhecido')
-                        # Remove caracteres inválidos do nome
-                        nome_emit_limpo = "".join(c for c in nome_emit if c.isalnum() or c in (' ', '-', '_')).strip()
-                        nome_base = f"{numero}_{nome_emit_limpo}"
-                        print(f"  📝 Nome personalizado: {nome_base}")
-                    else:
-                        # Nome padrão (chave de acesso)
-                        nome_base = chave
-                        print(f"  📝 Nome padrão (chave): {nome_base}")
-                    
-                    sucesso_xml = False
-                    sucesso_pdf = False
-                    xml_origem = None  # shared between XML and PDF fallback
-
-                    # Exporta XML
-                    if opcoes['exportar_xml']:
-                        print(f"  🔍 Procurando arquivo XML...")
-                        xml_origem = self._encontrar_arquivo_xml(chave)
-                        
-                        if xml_origem and xml_origem.exists():
-                            xml_destino = pasta_destino / f"{nome_base}.xml"
-                            print(f"  ✅ XML encontrado: {xml_origem}")
-                            print(f"  📤 Copiando para: {xml_destino}")
-                            shutil.copy2(xml_origem, xml_destino)
-                            sucesso_xml = True
-                        else:
-                            erro_msg = f"XML não encontrado: {chave}"
-                            print(f"  ❌ {erro_msg}")
-                            erros.append(erro_msg)
-                    
-                    # Exporta PDF
-                    if opcoes['exportar_pdf']:
-                        print(f"  🔍 Procurando arquivo PDF...")
-                        pdf_origem = self._encontrar_arquivo_pdf(chave)
-                        
-                        if pdf_origem and pdf_origem.exists():
-                            pdf_destino = pasta_destino / f"{nome_base}.pdf"
-                            print(f"  ✅ PDF encontrado: {pdf_origem}")
-                            print(f"  📤 Copiando para: {pdf_destino}")
-                            shutil.copy2(pdf_origem, pdf_destino)
-                            sucesso_pdf = True
-                        else:
-                            # Se PDF não existe, tenta gerar automaticamente
-                            print(f"  ⚠️  PDF não encontrado, tentando gerar...")
-                            
-                            # Reutiliza xml_origem se já encontrado acima, caso contrário busca agora
-                            if xml_origem is None or not xml_origem.exists():
-                                xml_origem = self._encontrar_arquivo_xml(chave)
-                            
-                            if xml_origem and xml_origem.exists():
-                                try:
-                                    # Lê o conteúdo do XML
-                                    with open(xml_origem, 'r', encoding='utf-8') as f:
-                                        xml_content = f.read()
-                                    
-                                    # Cria PDF temporário
-                                    import tempfile
-                                    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_pdf:
-                                        pdf_temp = Path(tmp_pdf.name)
-                                    
-                                    print(f"  🔄 Gerando PDF a partir do XML: {xml_origem.name}")
-                                    
-                                    # Gera PDF usando módulo pdf_simple
-                                    from modules.pdf_simple import generate_danfe_pdf
-                                    
-                                    tipo = doc.get('tipo', 'NFE')
-                                    if generate_danfe_pdf(xml_content, str(pdf_temp), tipo,
-                                                          xml_source_path=str(xml_origem)):
-                                        # PDF gerado com sucesso, copia para destino
-                                        pdf_destino = pasta_destino / f"{nome_base}.pdf"
-                                        print(f"  ✅ PDF gerado com sucesso!")
-                                        print(f"  📤 Copiando para: {pdf_destino}")
-                                        shutil.copy2(pdf_temp, pdf_destino)
-                                        sucesso_pdf = True
-                                        
-                                        # Remove arquivo temporário
-                                        pdf_temp.unlink()
-                                    else:
-                                        erro_msg = f"Falha ao gerar PDF: {chave}"
-                                        print(f"  ❌ {erro_msg}")
-                                        erros.append(erro_msg)
-                                        if pdf_temp.exists():
-                                            pdf_temp.unlink()
-                                except Exception as e_gen:
-                                    erro_msg = f"Erro ao gerar PDF {chave}: {str(e_gen)}"
-                                    print(f"  ❌ {erro_msg}")
-                                    erros.append(erro_msg)
-                            else:
-                                # XML não encontrado - comum para NFSe consultadas via API
-                                tipo_doc = doc.get('tipo', 'NFE')
-                                if tipo_doc == 'NFS-e':
-                                    # NFSe sem XML é esperado (consultadas via API sem XML completo)
-                                    print(f"  ⚠️  NFS-e sem arquivo XML disponível (dados apenas no banco)")
-                                    print(f"  ℹ️  Para gerar PDF, é necessário ter o XML completo salvo")
-                                    # Não adiciona erro para NFSe sem XML
-                                else:
-                                    erro_msg = f"XML não encontrado para gerar PDF: {chave}"
-                                    print(f"  ❌ {erro_msg}")
-                                    erros.append(erro_msg)
-                    
-                    if sucesso_xml or sucesso_pdf:
-                        exportados += 1
-                        print(f"  ✅ Exportado com sucesso!")
-                    else:
-                        # Documento não pôde ser exportado (sem XML e sem PDF)
-                        if doc.get('tipo') == 'NFS-e':
-                            print(f"  ⏭️  Pulando NFS-e sem arquivos disponíveis")
-                            pulados += 1
-                        else:
-                            print(f"  ❌ Nenhum arquivo exportado")
+            if chave_col_index is None:
+                QMessageBox.warning(self, "Exportar", "Coluna 'Chave' não encontrada!")
+                return
 
-                    
+            chaves = []
+            for row_index in sorted(tabela.selectionModel().selectedRows(), key=lambda r: r.row()):
+                chave_item = tabela.item(row_index.row(), chave_col_index)
+                if chave_item and chave_item.text().strip():
+                    chaves.append(chave_item.text().strip())
+            if not chaves:
+                QMessageBox.warning(self, "Exportar", "Nenhuma chave encontrada nas linhas selecionadas!")
+                return
+
+            if opcoes.get('formato') == 'zip':
+                sugestao = str(Path.home() / f"exportacao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+                caminho, _ = QFileDialog.getSaveFileName(self, "Salvar exportação como", sugestao, "ZIP (*.zip)")
+                if not caminho:
+                    return
+                destino = DestinoZip(caminho)
+            else:
+                pasta = QFileDialog.getExistingDirectory(self, "Selecionar pasta de destino para exportação")
+                if not pasta:
+                    return
+                destino = DestinoPasta(pasta)
+            print(f"[EXPORTAR] {len(chaves)} documento(s) → {destino.caminho}")
+        except Exception as e:
+            QMessageBox.critical(self, "Erro", f"Erro na exportação: {e}")
+            import traceback
+            traceback.print_exc()
+            return
+
+        db = self.db
+        exportador = ExportadorLote(
+            destino,
+            exportar_xml=opcoes['exportar_xml'],
+            exportar_pdf=opcoes['exportar_pdf'],
+            nome_personalizado=opcoes['nome_personalizado'],
+            layout=opcoes.get('layout', 'plano'),
+            localizar_xml=self._encontrar_arquivo_xml,
+            localizar_pdf=self._encontrar_arquivo_pdf,
+        )
+
+        class ExportacaoWorker(QThread):
+            progresso = pyqtSignal(int, int)    # feitos, total
+            concluido = pyqtSignal(object)      # stats do ExportadorLote
+            erro = pyqtSignal(str)
+
+            def run(self):
+                try:
+                    with db._connect() as conn:
+                        docs = localizar_em_lote(conn, chaves)
+                    fora_do_banco = [c for c in chaves if c not in docs]
+                    stats = exportador.executar([docs[c] for c in chaves if c in docs],
+                                                progresso=lambda feitos, total: self.progresso.emit(feitos, total))
+                    stats['erros'] = [f"Documento não encontrado no banco: {c}" for c in fora_do_banco] + stats['erros']
+                    self.concluido.emit(stats)
                 except Exception as e:
-                    erro_msg = f"{chave}: {str(e)}"
-                    print(f"  ❌ ERRO: {erro_msg}")
                     import traceback
                     traceback.print_exc()
-                    erros.append(erro_msg)
-            
-            progress.setValue(total)
-            
-            print("\n" + "="*60)
-            print("📊 RESUMO DA EXPORTAÇÃO")
-            print("="*60)
-            if pulados > 0:
-                print(f"⏭️  NFS-e puladas (sem arquivos): {pulados}")
-            print(f"❌ Erros: {len(erros)}")
-            print("="*60 + "\n")
-            
-            # Resultado
+                    destino.fechar(descartar=True)  # ZIP pela metade não fica no disco
+                    self.erro.emit(str(e))
+
+        progress = QProgressDialog("Localizando arquivos...", "Cancelar", 0, len(chaves), self)
+        progress.setWindowTitle("Exportar")
+        progress.setWindowModality(Qt.NonModal)  # a janela continua utilizável durante exportações grandes
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        progress.show()
+
+        worker = ExportacaoWorker()
+        self._exportacao_worker = worker
+
+        def _on_cancelar():
+            exportador.cancelar()
+            progress.setLabelText("Cancelando... aguardando as leituras em andamento")
+
+        def _on_progresso(feitos, total):
+            progress.setMaximum(max(total, 1))
+            progress.setValue(feitos)
+            progress.setLabelText(f"Exportando {feitos}/{total}...")
+
+        def _on_concluido(stats):
+            progress.close()
+            erros = stats['erros']
+            for erro in erros:
+                print(f"  ❌ {erro}")
+            if stats['cancelado']:
+                mensagem = "Exportação cancelada.\n\n"
+                if isinstance(destino, DestinoZip):
+                    mensagem += "O arquivo ZIP incompleto foi descartado."
+                else:
+                    mensagem += f"✅ Documentos já exportados: {stats['exportados']}\n📁 Destino: {destino.caminho}"
+                QMessageBox.information(self, "Exportar", mensagem)
+                return
+
             mensagem = f"Exportação concluída!\n\n"
-            mensagem += f"✅ Arquivos exportados: {exportados}\n"
-            if pulados > 0:
-                mensagem += f"⏭️  NFS-e puladas (sem arquivos): {pulados}\n"
-                mensagem += f"    (Estas NFS-e foram consultadas via API mas não possuem\n"
+            mensagem += f"✅ Arquivos exportados: {stats['exportados']}\n"
+            if stats['pulados'] > 0:
+                mensagem += f"⏭️  Documentos sem arquivos disponíveis: {stats['pulados']}\n"
+                mensagem += f"    (NFS-e consultadas via API não possuem\n"
                 mensagem += f"     arquivo XML/PDF disponível para exportação)\n"
-            mensagem += f"📁 Destino: {pasta_destino}\n"
-            
+            mensagem += f"📁 Destino: {destino.caminho}\n"
+            mensagem += f"💾 {stats['arquivos']} arquivo(s), {stats['bytes'] / 1048576:.1f} MB\n"
+
             if erros:
                 mensagem += f"\n❌ Erros: {len(erros)}"
                 if len(erros) <= 5:
@@ -14181,13 +14185,23 @@ class MainWindow(QMainWindow):
                 else:
                     mensagem += f"\n\nPrimeiros 5 erros:\n" + "\n".join(erros[:5])
                     mensagem += f"\n\n(Veja o console para lista completa)"
-            
+
             QMessageBox.information(self, "Exportar", mensagem)
-            
-        except Exception as e:
-            QMessageBox.critical(self, "Erro", f"Erro na exportação: {e}")
-            import traceback
-            traceback.print_exc()
+
+        def _on_erro(mensagem):
+            progress.close()
+            QMessageBox.critical(self, "Erro", f"Erro na exportação: {mensagem}")
+
+        def _on_finished():
+            self._exportacao_worker = None
+            worker.deleteLater()
+
+        progress.canceled.connect(_on_cancelar)
+        worker.progresso.connect(_on_progresso)
+        worker.concluido.connect(_on_concluido)
+        worker.erro.connect(_on_erro)
+        worker.finished.connect(_on_finished)
+        worker.start()
     
     def _encontrar_arquivo_xml(self, chave):
         """Encontra o arquivo XML de uma chave de acesso."""
@@ -14205,6 +14219,9 @@ class MainWindow(QMainWindow):
                 for row_c in rows_c:
                     xml_path = Path(row_c[0])
                     label = f"{row_c[1]}{(' / ' + row_c[2]) if row_c[2] else ''}"
+                    if is_caminho_arquivado(row_c[0]) and caminho_existe(row_c[0]):
+                        print(f"    📦 XML encontrado no arquivo mensal [{label}]: {row_c[0]}")
+                        return extrair_temporario(row_c[0])
                     if xml_path.exists():
                         print(f"    ✅ XML encontrado no banco [{label}]: {xml_path}")
                         return xml_path
@@ -14217,6 +14234,9 @@ class MainWindow(QMainWindow):
                 ).fetchone()
                 if row_b and row_b[0]:
                     xml_path = Path(row_b[0])
+                    if is_caminho_arquivado(row_b[0]) and caminho_existe(row_b[0]):
+                        print(f"    📦 XML encontrado no arquivo mensal (xmls_baixados): {row_b[0]}")
+                        return extrair_temporario(row_b[0])
                     if xml_path.exists():
                         print(f"    ✅ XML encontrado (xmls_baixados): {xml_path}")
                         return xml_path
@@ -14397,7 +14417,7 @@ class MainWindow(QMainWindow):
                     (chave,)
                 ).fetchall()
                 for row_c in rows_c:
-                    xml_path = Path(row_c[0])
+                    xml_path = caminho_solto(row_c[0])  # PDF fica solto mesmo com XML arquivado
                     pdf_path = xml_path.with_suffix('.pdf')
                     label = f"{row_c[1]}{(' / ' + row_c[2]) if row_c[2] else ''}"
                     if pdf_path.exists():
@@ -14409,7 +14429,7 @@ class MainWindow(QMainWindow):
                     (chave,)
                 ).fetchone()
                 if row_b and row_b[0]:
-                    xml_path = Path(row_b[0])
+                    xml_path = caminho_solto(row_b[0])
                     pdf_path = xml_path.with_suffix('.pdf')
                     if pdf_path.exists():
                         print(f"    ✅ PDF encontrado (xmls_baixados): {pdf_path}")
@@ -14498,839 +14518,235 @@ class MainWindow(QMainWindow):
                             return pdf_g
                     if numero_nd:
                         for f_xml in pasta.glob(f"{numero_nd}-*.xml"):
-                            f_pdf = f_xml.with_suffix('.pdf')
-                            if f_pdf.exists():
-                                print(f"    ✅ PDF encontrado por número {numero_nd}: {f_pdf}")
-                                return f_pdf
-                    for f_xml in pasta.rglob("*.xml"):
-                        try:
-                            with open(f_xml, 'r', encoding='utf-8', errors='ignore') as fh:
-                                if chave in fh.read(4000):
-                                    f_pdf = f_xml.with_suffix('.pdf')
-                                    if f_pdf.exists():
-                                        print(f"    ✅ PDF encontrado (pasta direta): {f_pdf}")
-                                        return f_pdf
-                        except Exception:
-                            continue
-        except Exception as e_smart:
-            print(f"    ⚠️ Erro na busca inteligente PDF: {e_smart}")
-
-        # PRIORIDADE 2: Busca em estrutura por informante
-        xmls_dir = DATA_DIR / 'xmls'
-        if xmls_dir.exists():
-            print(f"    📂 Buscando em estrutura: {xmls_dir}")
-            
-            # Primeiro tenta busca rápida por nome de arquivo com chave
-            for pdf_file in xmls_dir.rglob(f"{chave}.pdf"):
-                print(f"    ✅ Arquivo encontrado: {pdf_file}")
-                return pdf_file
-            
-            # Se não encontrar, procura PDF que corresponda a XML com a chave
-            # (busca arquivos .xml e verifica se existe .pdf correspondente)
-            print(f"    🔍 Chave não encontrada no nome, buscando PDF correspondente ao XML...")
-            xml_files = list(xmls_dir.rglob("*.xml"))
-            
-            # Filtra arquivos de debug/protocolo/resumo e pastas de debug
-            _pastas_excluir_pdf = {'debug de notas', 'resumos', 'eventos', 'debug', 'outros'}
-            xml_files = [
-                f for f in xml_files 
-                if not any(x in f.name.lower() for x in ['debug', 'protocolo', 'request', 'response', 'resumo', '_extraido_'])
-                and not any(part.lower() in _pastas_excluir_pdf for part in f.parts)
-            ]
-            
-            # Busca a chave no conteúdo do XML e verifica se existe PDF (varredura completa)
-            for xml_file in xml_files:
-                try:
-                    with open(xml_file, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read(2000)  # Lê apenas início do arquivo
-                        if chave in content:
-                            # Verifica se existe PDF com mesmo nome
-                            pdf_file = xml_file.with_suffix('.pdf')
-                            if pdf_file.exists():
-                                print(f"    ✅ PDF encontrado correspondente ao XML: {pdf_file}")
-                                return pdf_file
-                            else:
-                                print(f"    ⚠️ XML encontrado mas PDF não existe: {xml_file.name}")
-                except Exception:
-                    continue
-        
-        # PRIORIDADE 3: Busca em diretórios legados
-        diretorios = [
-            BASE_DIR / 'xmls_chave',
-            BASE_DIR / 'xml_extraidos',
-            BASE_DIR / 'xml_NFs',
-        ]
-        
-        for diretorio in diretorios:
-            if diretorio.exists():
-                print(f"    📂 Verificando diretório legado: {diretorio}")
-                for pdf_file in diretorio.rglob(f"*{chave}*.pdf"):
-                    print(f"    ✅ Arquivo encontrado: {pdf_file}")
-                    return pdf_file
-        
-        print(f"    ❌ PDF não encontrado em nenhum local")
-        return None
-
-    def abrir_relatorio(self):
-        """Abre diálogo de relatório analítico IBS/CBS com filtros de período e empresa."""
-        from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
-                                     QDateEdit, QComboBox, QTableWidget, QTableWidgetItem,
-                                     QPushButton, QHeaderView, QFileDialog, QMessageBox,
-                                     QProgressDialog)
-        from PyQt5.QtCore import QDate, Qt
-        from datetime import datetime
-        
-        try:
-            # Cria dialog
-            dialog = QDialog(self)
-            dialog.setWindowTitle("Relatório IBS/CBS")
-            dialog.resize(1400, 800)
-            
-            # Layout principal
-            layout = QVBoxLayout(dialog)
-            
-            # === FILTROS ===
-            filter_layout = QHBoxLayout()
-            
-            # Período
-            filter_layout.addWidget(QLabel("Período:"))
-            date_inicio = QDateEdit(QDate.currentDate().addMonths(-1))
-            date_inicio.setDisplayFormat("dd/MM/yyyy")
-            date_inicio.setCalendarPopup(True)
-            date_fim = QDateEdit(QDate.currentDate())
-            date_fim.setDisplayFormat("dd/MM/yyyy")
-            date_fim.setCalendarPopup(True)
-            filter_layout.addWidget(date_inicio)
-            filter_layout.addWidget(QLabel("até"))
-            filter_layout.addWidget(date_fim)
-            
-            # Empresa
-            filter_layout.addWidget(QLabel("Empresa:"))
-            combo_empresa = QComboBox()
-            combo_empresa.setMinimumWidth(250)
-            filter_layout.addWidget(combo_empresa)
-            
-            # Botões
-            btn_atualizar = QPushButton("🔄 Atualizar")
-            btn_exportar_excel = QPushButton("📊 Exportar Excel")
-            btn_exportar_excel.setEnabled(False)
-            filter_layout.addWidget(btn_atualizar)
-            filter_layout.addWidget(btn_exportar_excel)
-            filter_layout.addStretch()
-            
-            layout.addLayout(filter_layout)
-            
-            # === TABELA ===
-            table = QTableWidget()
-            headers = ["Data", "Tipo", "Número", "Emitente", "Destinatário", 
-                      "Valor Total", "IBS", "CBS", "Chave"]
-            table.setColumnCount(len(headers))
-            table.setHorizontalHeaderLabels(headers)
-            
-            # Adiciona tooltips aos headers IBS e CBS
-            header_item_ibs = table.horizontalHeaderItem(6)
-            if header_item_ibs:
-                header_item_ibs.setToolTip("Imposto sobre Bens e Serviços (Reforma Tributária)")
-            
-            header_item_cbs = table.horizontalHeaderItem(7)
-            if header_item_cbs:
-                header_item_cbs.setToolTip("Contribuição sobre Bens e Serviços (Reforma Tributária)")
-            
-            table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
-            table.horizontalHeader().setStretchLastSection(True)
-            table.setSelectionBehavior(QTableWidget.SelectRows)
-            table.setSelectionMode(QTableWidget.ExtendedSelection)  # Permite múltipla seleção
-            table.setEditTriggers(QTableWidget.NoEditTriggers)
-            table.setSortingEnabled(True)  # Permite ordenar por clique nos cabeçalhos
-            layout.addWidget(table)
-            
-            # Label de status
-            lbl_status = QLabel("Selecione o período e clique em Atualizar")
-            layout.addWidget(lbl_status)
-            
-            # Label de totais (rodapé)
-            lbl_totais = QLabel("")
-            lbl_totais.setStyleSheet("QLabel { background-color: #f0f0f0; padding: 8px; font-weight: bold; border: 1px solid #ccc; }")
-            layout.addWidget(lbl_totais)
-            
-            # === FUNÇÕES AUXILIARES ===
-            
-            def converter_moeda_para_float(valor_str):
-                """Converte string formatada (1.234,56) para float."""
-                try:
-                    if not valor_str or valor_str == "0,00":
-                        return 0.0
-                    # Remove pontos de milhar e troca vírgula por ponto
-                    valor_limpo = valor_str.replace('.', '').replace(',', '.')
-                    return float(valor_limpo)
-                except:
-                    return 0.0
-            
-            def atualizar_totais():
-                """Atualiza label de totais com base nas linhas selecionadas."""
-                try:
-                    selected_rows = table.selectionModel().selectedRows()
-                    
-                    if not selected_rows:
-                        lbl_totais.setText("")
-                        return
-                    
-                    # Calcula totais das colunas 5 (Valor Total), 6 (IBS), 7 (CBS)
-                    total_valor = 0.0
-                    total_ibs = 0.0
-                    total_cbs = 0.0
-                    
-                    for row_index in selected_rows:
-                        row = row_index.row()
-                        
-                        # Valor Total (coluna 5)
-                        item_valor = table.item(row, 5)
-                        if item_valor:
-                            total_valor += converter_moeda_para_float(item_valor.text())
-                        
-                        # IBS (coluna 6)
-                        item_ibs = table.item(row, 6)
-                        if item_ibs:
-                            total_ibs += converter_moeda_para_float(item_ibs.text())
-                        
-                        # CBS (coluna 7)
-                        item_cbs = table.item(row, 7)
-                        if item_cbs:
-                            total_cbs += converter_moeda_para_float(item_cbs.text())
-                    
-                    # Formata totais
-                    texto_totais = f"Selecionados: {len(selected_rows)} documento(s)  |  "
-                    texto_totais += f"Total Valor: {formatar_moeda(total_valor)}  |  "
-                    texto_totais += f"Total IBS: {formatar_moeda(total_ibs)}  |  "
-                    texto_totais += f"Total CBS: {formatar_moeda(total_cbs)}"
-                    
-                    lbl_totais.setText(texto_totais)
-                    
-                except Exception as e:
-                    print(f"Erro ao calcular totais: {e}")
-            
-            def formatar_moeda(valor):
-                """Formata valor no padrão monetário brasileiro (1.234,56)."""
-                try:
-                    if valor is None or valor == "":
-                        return "0,00"
-                    
-                    # Se já está formatado (contém "R$"), limpa e reconverte
-                    if isinstance(valor, str):
-                        # Remove "R$", espaços e outros caracteres não numéricos (exceto dígitos, vírgula e ponto)
-                        valor_limpo = valor.replace('R$', '').replace(' ', '').strip()
-                        
-                        # Se tem vírgula, está no formato brasileiro (1.234,56)
-                        if ',' in valor_limpo:
-                            # Remove pontos de milhar e troca vírgula por ponto
-                            valor_limpo = valor_limpo.replace('.', '').replace(',', '.')
-                        
-                        # Tenta converter para float
-                        try:
-                            valor_float = float(valor_limpo)
-                        except ValueError:
-                            return "0,00"
-                    else:
-                        valor_float = float(valor)
-                    
-                    # Formata no padrão brasileiro manualmente (independente de locale)
-                    # Separa parte inteira e decimal
-                    valor_abs = abs(valor_float)
-                    parte_inteira = int(valor_abs)
-                    parte_decimal = int(round((valor_abs - parte_inteira) * 100))
-                    
-                    # Formata parte inteira com separador de milhar (.)
-                    parte_int_str = f"{parte_inteira:,}".replace(',', '.')
-                    
-                    # Monta valor final
-                    valor_formatado = f"{'-' if valor_float < 0 else ''}{parte_int_str},{parte_decimal:02d}"
-                    
-                    return valor_formatado
-                except:
-                    return "0,00"
-            
-            def extrair_ibs_cbs_do_xml(chave):
-                """
-                Extrai valores de IBS e CBS do XML da nota.
-                
-                ⚠️ FUNÇÃO LEGADA - Usada apenas como fallback para notas antigas sem IBS/CBS no banco.
-                Para melhor performance, execute: Menu > Configurações > Atualizar IBS/CBS das Notas (Ctrl+Shift+U)
-                Isso populará o banco e tornará o relatório muito mais rápido.
-                """
-                try:
-                    from lxml import etree
-                    from pathlib import Path
-                    
-                    # Busca rápida do XML (sem busca pesada em conteúdo)
-                    xml_path = None
-                    
-                    # PRIORIDADE 1: Consulta banco de dados
-                    try:
-                        with self.db._connect() as conn:
-                            cursor = conn.execute(
-                                "SELECT caminho_arquivo FROM xmls_baixados WHERE chave = ?",
-                                (chave,)
-                            )
-                            row = cursor.fetchone()
-                            if row and row[0]:
-                                xml_path = Path(row[0])
-                                if not xml_path.exists():
-                                    xml_path = None
-                    except:
-                        pass
-                    
-                    # PRIORIDADE 2: Busca rápida por nome de arquivo apenas
-                    if not xml_path:
-                        xmls_dir = DATA_DIR / 'xmls'
-                        if xmls_dir.exists():
-                            # Busca apenas por nome de arquivo (rápido)
-                            matches = list(xmls_dir.rglob(f"{chave}.xml"))
-                            if matches:
-                                xml_path = matches[0]
-                    
-                    # Se não encontrou, retorna zero (não faz busca pesada)
-                    if not xml_path or not xml_path.exists():
-                        return "0,00", "0,00"
-                    
-                    # Lê e parseia o XML
-                    with open(xml_path, 'r', encoding='utf-8') as f:
-                        xml_content = f.read()
-                    
-                    # NFS-e não tem IBS/CBS (são impostos de NF-e)
-                    if 'nfse' in xml_content.lower() or 'servico' in xml_content.lower():
-                        return "0,00", "0,00"
-                    
-                    tree = etree.fromstring(xml_content.encode('utf-8'))
-                    
-                    # Namespaces comuns para NF-e
-                    ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                    
-                    ibs_value = None
-                    cbs_value = None
-                    
-                    # ESTRATÉGIA 1: Busca com namespace específico
-                    ibs_tags = tree.xpath('.//nfe:vIBS', namespaces=ns)
-                    if ibs_tags and ibs_tags[0].text:
-                        ibs_value = ibs_tags[0].text
-                    
-                    cbs_tags = tree.xpath('.//nfe:vCBS', namespaces=ns)
-                    if cbs_tags and cbs_tags[0].text:
-                        cbs_value = cbs_tags[0].text
-                    
-                    # ESTRATÉGIA 2: Busca em ICMSTot com namespace
-                    if not ibs_value:
-                        ibs_total = tree.xpath('.//nfe:ICMSTot/nfe:vIBS', namespaces=ns)
-                        if ibs_total and ibs_total[0].text:
-                            ibs_value = ibs_total[0].text
-                    
-                    if not cbs_value:
-                        cbs_total = tree.xpath('.//nfe:ICMSTot/nfe:vCBS', namespaces=ns)
-                        if cbs_total and cbs_total[0].text:
-                            cbs_value = cbs_total[0].text
-                    
-                    # ESTRATÉGIA 3: Busca sem namespace (local-name)
-                    if not ibs_value:
-                        ibs_no_ns = tree.xpath(".//*[local-name()='vIBS']")
-                        if ibs_no_ns and ibs_no_ns[0].text:
-                            ibs_value = ibs_no_ns[0].text
-                    
-                    if not cbs_value:
-                        cbs_no_ns = tree.xpath(".//*[local-name()='vCBS']")
-                        if cbs_no_ns and cbs_no_ns[0].text:
-                            cbs_value = cbs_no_ns[0].text
-                    
-                    # ESTRATÉGIA 4: Busca texto no XML (fallback)
-                    if not ibs_value and '<vIBS>' in xml_content:
-                        import re
-                        match = re.search(r'<vIBS>([\d.,]+)</vIBS>', xml_content)
-                        if match:
-                            ibs_value = match.group(1)
-                    
-                    if not cbs_value and '<vCBS>' in xml_content:
-                        import re
-                        match = re.search(r'<vCBS>([\d.,]+)</vCBS>', xml_content)
-                        if match:
-                            cbs_value = match.group(1)
-                    
-                    return ibs_value or "0.00", cbs_value or "0.00"
-                    
-                except Exception as e:
-                    # Erro silencioso - retorna zero
-                    return "0,00", "0,00"
-            
-            def popular_empresas():
-                """Popula combo com empresas (CNPJs dos certificados - destinatários)."""
-                try:
-                    combo_empresa.clear()
-                    combo_empresa.addItem("Todas as empresas", None)
-                    
-                    # Busca empresas dos certificados configurados
-                    with self.db._connect() as conn:
-                        # Verifica se as colunas existem
-                        cursor = conn.execute("PRAGMA table_info(certificados)")
-                        columns = {col[1] for col in cursor.fetchall()}
-                        
-                        # Monta query baseada nas colunas disponíveis
-                        if 'razao_social' in columns and 'ativo' in columns:
-                            cursor = conn.execute("""
-                                SELECT cnpj_cpf, razao_social 
-                                FROM certificados 
-                                WHERE ativo = 1 
-                                ORDER BY razao_social
-                            """)
-                        elif 'razao_social' in columns:
-                            cursor = conn.execute("""
-                                SELECT cnpj_cpf, razao_social 
-                                FROM certificados 
-                                ORDER BY razao_social
-                            """)
-                        elif 'nome_certificado' in columns:
-                            cursor = conn.execute("""
-                                SELECT cnpj_cpf, nome_certificado 
-                                FROM certificados 
-                                ORDER BY nome_certificado
-                            """)
-                        else:
-                            cursor = conn.execute("""
-                                SELECT cnpj_cpf, informante 
-                                FROM certificados 
-                                ORDER BY informante
-                            """)
-                        
-                        empresas = cursor.fetchall()
-                        if empresas:
-                            for cnpj, nome in empresas:
-                                if cnpj:
-                                    combo_empresa.addItem(f"{cnpj} - {nome or 'Sem Nome'}", cnpj)
-                        else:
-                            # Fallback: busca destinatários únicos das notas
-                            cursor = conn.execute("""
-                                SELECT DISTINCT cnpj_destinatario 
-                                FROM notas_detalhadas 
-                                WHERE cnpj_destinatario IS NOT NULL 
-                                ORDER BY cnpj_destinatario
-                            """)
-                            destinatarios = cursor.fetchall()
-                            for (cnpj,) in destinatarios:
-                                if cnpj:
-                                    combo_empresa.addItem(cnpj, cnpj)
-                
-                except Exception as e:
-                    QMessageBox.warning(dialog, "Erro", f"Erro ao carregar empresas: {e}")
-            
-            def atualizar_relatorio():
-                """Atualiza tabela com dados do período e empresa selecionados."""
-                try:
-                    # Limpa tabela
-                    table.setRowCount(0)
-                    btn_exportar_excel.setEnabled(False)
-                    lbl_totais.setText("")  # Limpa totais
-                    
-                    # Pega filtros
-                    data_ini = date_inicio.date().toString("yyyy-MM-dd")
-                    data_fim = date_fim.date().toString("yyyy-MM-dd")
-                    cnpj_filtro = combo_empresa.currentData()
-                    
-                    lbl_status.setText(f"Buscando dados de {date_inicio.date().toString('dd/MM/yyyy')} até {date_fim.date().toString('dd/MM/yyyy')}...")
-                    dialog.repaint()
-                    
-                    # Query SQL - Filtra por DESTINATÁRIO (emitidas por terceiros)
-                    # Inclui NFS-e usando informante OU cnpj_destinatario
-                    # 🚀 PERFORMANCE: Inclui v_ibs e v_cbs na query (evita ler XMLs)
-                    query = """
-                        SELECT chave, data_emissao, tipo, numero, nome_emitente, 
-                               cnpj_destinatario, valor, informante, v_ibs, v_cbs
-                        FROM notas_detalhadas
-                        WHERE data_emissao BETWEEN ? AND ?
-                    """
-                    params = [data_ini, data_fim]
-                    
-                    if cnpj_filtro:
-                        # Para NFS-e, verifica tanto cnpj_destinatario quanto informante
-                        query += " AND (cnpj_destinatario = ? OR (tipo LIKE '%NFS%' AND informante = ?))"
-                        params.extend([cnpj_filtro, cnpj_filtro])
-                    
-                    query += " ORDER BY data_emissao DESC"
-                    
-                    with self.db._connect() as conn:
-                        cursor = conn.execute(query, params)
-                        rows = cursor.fetchall()
-                    
-                    if not rows:
-                        lbl_status.setText("Nenhum documento encontrado no período selecionado")
-                        return
-                    
-                    # Progress dialog
-                    progress = QProgressDialog("Processando documentos...", "Cancelar", 0, len(rows), dialog)
-                    progress.setWindowTitle("Gerando Relatório")
-                    progress.setWindowModality(Qt.WindowModal)
-                    progress.show()
-                    
-                    # Desabilita ordenação durante preenchimento (performance)
-                    table.setSortingEnabled(False)
-                    
-                    # Popula tabela
-                    table.setRowCount(len(rows))
-                    
-                    # Contador para rastrear extrações de XML (fallback para notas antigas)
-                    extraidos_xml = 0
-                    
-                    for idx, row in enumerate(rows):
-                        if progress.wasCanceled():
-                            break
-                        
-                        chave, data_emissao, tipo, numero, nome_emit, cnpj_dest, valor, informante, v_ibs_db, v_cbs_db = row
-                        
-                        # Garante que valor seja float para formatação correta
-                        try:
-                            valor = float(valor) if valor else 0.0
-                        except (ValueError, TypeError):
-                            valor = 0.0
-                        
-                        # 🚀 PERFORMANCE OTIMIZADA: Sempre usa valores do banco quando disponíveis
-                        # Só extrai do XML se valores estiverem NULL (notas antigas nunca atualizadas)
-                        if v_ibs_db is not None and v_cbs_db is not None:
-                            # Valores já estão no banco (podem ser zero, mas isso é correto)
-                            # Garante conversão para float para formatação correta
-                            try:
-                                ibs = float(v_ibs_db) if v_ibs_db else 0.0
-                                cbs = float(v_cbs_db) if v_cbs_db else 0.0
-                            except (ValueError, TypeError):
-                                ibs = 0.0
-                                cbs = 0.0
-                        else:
-                            # Fallback: Extrai do XML (apenas para notas antigas sem IBS/CBS no banco)
-                            # Sugestão: Execute "Atualizar IBS/CBS" no menu para popular o banco
-                            ibs_str, cbs_str = extrair_ibs_cbs_do_xml(chave)
-                            # Converte strings retornadas para float
-                            try:
-                                ibs = float(ibs_str) if ibs_str else 0.0
-                                cbs = float(cbs_str) if cbs_str else 0.0
-                            except (ValueError, TypeError):
-                                ibs = 0.0
-                                cbs = 0.0
-                            extraidos_xml += 1
-                        
-                        # Atualiza progresso apenas a cada 50 documentos (performance)
-                        if idx % 50 == 0 or idx == len(rows) - 1:
-                            progress.setLabelText(f"Processando {idx+1}/{len(rows)} documentos...")
-                            progress.setValue(idx)
-                        
-                        # Formata data
-                        try:
-                            data_fmt = datetime.strptime(data_emissao, "%Y-%m-%d").strftime("%d/%m/%Y")
-                        except:
-                            data_fmt = data_emissao
-                        
-                        # Preenche linha
-                        table.setItem(idx, 0, QTableWidgetItem(data_fmt))
-                        table.setItem(idx, 1, QTableWidgetItem(tipo or ""))
-                        table.setItem(idx, 2, QTableWidgetItem(numero or ""))
-                        table.setItem(idx, 3, QTableWidgetItem(nome_emit or ""))
-                        table.setItem(idx, 4, QTableWidgetItem(cnpj_dest or ""))
-                        table.setItem(idx, 5, QTableWidgetItem(formatar_moeda(valor)))
-                        table.setItem(idx, 6, QTableWidgetItem(formatar_moeda(ibs)))
-                        table.setItem(idx, 7, QTableWidgetItem(formatar_moeda(cbs)))
-                        table.setItem(idx, 8, QTableWidgetItem(chave or ""))
-                    
-                    progress.setValue(len(rows))
-                    
-                    # Reabilita ordenação após preencher
-                    table.setSortingEnabled(True)
-                    
-                    # Monta mensagem de status com informações de performance
-                    status_msg = f"✅ Relatório gerado: {len(rows)} documento(s)"
-                    
-                    if extraidos_xml > 0:
-                        # Há notas antigas sem IBS/CBS no banco
-                        status_msg += f" | ⚠️ {extraidos_xml} nota(s) extraída(s) do XML (lento)"
-                        status_msg += " | 💡 Execute 'Atualizar IBS/CBS' no menu para acelerar relatórios futuros"
-                    else:
-                        # Todos os dados vieram do banco (performance máxima)
-                        status_msg += " | 🚀 IBS/CBS do banco (rápido)"
-                    
-                    lbl_status.setText(status_msg)
-                    btn_exportar_excel.setEnabled(True)
-                    
-                except Exception as e:
-                    QMessageBox.critical(dialog, "Erro", f"Erro ao gerar relatório: {e}")
-                    import traceback
-                    traceback.print_exc()
-            
-            def exportar_excel():
-                """Exporta dados da tabela para Excel."""
-                try:
-                    # Verifica se há dados
-                    if table.rowCount() == 0:
-                        QMessageBox.warning(dialog, "Aviso", "Não há dados para exportar")
-                        return
-                    
-                    # Seleciona arquivo destino
-                    data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    arquivo_sugerido = f"Relatorio_IBS_CBS_{data_hora}.xlsx"
-                    
-                    arquivo, _ = QFileDialog.getSaveFileName(
-                        dialog,
-                        "Salvar Relatório Excel",
-                        arquivo_sugerido,
-                        "Excel Files (*.xlsx)"
-                    )
-                    
-                    if not arquivo:
-                        return
-                    
-                    # Importa openpyxl
-                    try:
-                        from openpyxl import Workbook
-                        from openpyxl.styles import Font, Alignment, PatternFill
-                    except ImportError:
-                        QMessageBox.critical(
-                            dialog,
-                            "Erro",
-                            "Biblioteca openpyxl não instalada.\n\n"
-                            "Execute: pip install openpyxl"
-                        )
-                        return
-                    
-                    # Cria workbook
-                    wb = Workbook()
-                    ws = wb.active
-                    ws.title = "Relatório IBS CBS"
-                    
-                    # Cabeçalhos
-                    headers = [table.horizontalHeaderItem(i).text() for i in range(table.columnCount())]
-                    ws.append(headers)
-                    
-                    # Formata cabeçalho
-                    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                    header_font = Font(color="FFFFFF", bold=True)
-                    
-                    for cell in ws[1]:
-                        cell.fill = header_fill
-                        cell.font = header_font
-                        cell.alignment = Alignment(horizontal="center", vertical="center")
-                    
-                    # Dados
-                    for row_idx in range(table.rowCount()):
-                        row_data = []
-                        for col_idx in range(table.columnCount()):
-                            item = table.item(row_idx, col_idx)
-                            row_data.append(item.text() if item else "")
-                        ws.append(row_data)
-                    
-                    # Formata colunas de valores monetários (Valor Total, IBS, CBS) - alinhamento à direita
-                    for row_idx in range(2, ws.max_row + 1):
-                        # Coluna 6 = Valor Total, 7 = IBS, 8 = CBS (índice 1-based)
-                        for col_idx in [6, 7, 8]:
-                            cell = ws.cell(row=row_idx, column=col_idx)
-                            cell.alignment = Alignment(horizontal="right", vertical="center")
-                    
-                    # Ajusta largura das colunas
-                    for column in ws.columns:
-                        max_length = 0
-                        column_letter = column[0].column_letter
-                        for cell in column:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(str(cell.value))
-                            except:
-                                pass
-                        adjusted_width = min(max_length + 2, 50)
-                        ws.column_dimensions[column_letter].width = adjusted_width
-                    
-                    # Salva arquivo
-                    wb.save(arquivo)
-                    
-                    QMessageBox.information(
-                        dialog,
-                        "Sucesso",
-                        f"Relatório exportado com sucesso!\n\n{arquivo}"
-                    )
-                    
-                except Exception as e:
-                    QMessageBox.critical(dialog, "Erro", f"Erro ao exportar Excel: {e}")
-                    import traceback
-                    traceback.print_exc()
+                            f_pdf = f_xml.with_suffix('.pdf')
+                            if f_pdf.exists():
+                                print(f"    ✅ PDF encontrado por número {numero_nd}: {f_pdf}")
+                                return f_pdf
+                    for f_xml in pasta.rglob("*.xml"):
+                        try:
+                            with open(f_xml, 'r', encoding='utf-8', errors='ignore') as fh:
+                                if chave in fh.read(4000):
+                                    f_pdf = f_xml.with_suffix('.pdf')
+                                    if f_pdf.exists():
+                                        print(f"    ✅ PDF encontrado (pasta direta): {f_pdf}")
+                                        return f_pdf
+                        except Exception:
+                            continue
+        except Exception as e_smart:
+            print(f"    ⚠️ Erro na busca inteligente PDF: {e_smart}")
+
+        # PRIORIDADE 2: Busca em estrutura por informante
+        xmls_dir = DATA_DIR / 'xmls'
+        if xmls_dir.exists():
+            print(f"    📂 Buscando em estrutura: {xmls_dir}")
             
-            # === CONECTA SINAIS ===
-            btn_atualizar.clicked.connect(atualizar_relatorio)
-            btn_exportar_excel.clicked.connect(exportar_excel)
-            table.itemSelectionChanged.connect(atualizar_totais)  # Atualiza totais ao selecionar linhas
+            # Primeiro tenta busca rápida por nome de arquivo com chave
+            for pdf_file in xmls_dir.rglob(f"{chave}.pdf"):
+                print(f"    ✅ Arquivo encontrado: {pdf_file}")
+                return pdf_file
             
-            # Inicializa
-            popular_empresas()
+            # Se não encontrar, procura PDF que corresponda a XML com a chave
+            # (busca arquivos .xml e verifica se existe .pdf correspondente)
+            print(f"    🔍 Chave não encontrada no nome, buscando PDF correspondente ao XML...")
+            xml_files = list(xmls_dir.rglob("*.xml"))
             
-            # Mostra dialog
-            dialog.exec_()
+            # Filtra arquivos de debug/protocolo/resumo e pastas de debug
+            _pastas_excluir_pdf = {'debug de notas', 'resumos', 'eventos', 'debug', 'outros'}
+            xml_files = [
+                f for f in xml_files 
+                if not any(x in f.name.lower() for x in ['debug', 'protocolo', 'request', 'response', 'resumo', '_extraido_'])
+                and not any(part.lower() in _pastas_excluir_pdf for part in f.parts)
+            ]
             
-        except Exception as e:
-            QMessageBox.critical(self, "Erro", f"Erro ao abrir relatório: {e}")
-            import traceback
-            traceback.print_exc()
-
-    def abrir_relatorios_menu(self):
-        """Abre menu de seleção de relatórios."""
-        from PyQt5.QtWidgets import QDialog, QVBoxLayout, QPushButton, QLabel
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Relatórios")
-        dialog.setFixedSize(340, 160)
-        layout = QVBoxLayout(dialog)
-        layout.setSpacing(10)
-        layout.addWidget(QLabel("<b>Selecione o relatório desejado:</b>"))
-
-        btn_ibs = QPushButton("💰  Relatório IBS/CBS")
-        btn_ibs.setMinimumHeight(42)
-        btn_ibs.setToolTip("Relatório analítico com IBS e CBS por nota fiscal")
-        btn_ibs.clicked.connect(lambda: (dialog.accept(), self.abrir_relatorio()))
-        layout.addWidget(btn_ibs)
-
-        btn_notas = QPushButton("📄  Relatório de Notas")
-        btn_notas.setMinimumHeight(42)
-        btn_notas.setToolTip("Relatório de todas as notas da empresa: número, valor e impostos")
-        btn_notas.clicked.connect(lambda: (dialog.accept(), self.abrir_relatorio_notas()))
-        layout.addWidget(btn_notas)
+            # Busca a chave no conteúdo do XML e verifica se existe PDF (varredura completa)
+            for xml_file in xml_files:
+                try:
+                    with open(xml_file, 'r', encoding='utf-8', errors='ignore') as f:
+                        content = f.read(2000)  # Lê apenas início do arquivo
+                        if chave in content:
+                            # Verifica se existe PDF com mesmo nome
+                            pdf_file = xml_file.with_suffix('.pdf')
+                            if pdf_file.exists():
+                                print(f"    ✅ PDF encontrado correspondente ao XML: {pdf_file}")
+                                return pdf_file
+                            else:
+                                print(f"    ⚠️ XML encontrado mas PDF não existe: {xml_file.name}")
+                except Exception:
+                    continue
+        
+        # PRIORIDADE 3: Busca em diretórios legados
+        diretorios = [
+            BASE_DIR / 'xmls_chave',
+            BASE_DIR / 'xml_extraidos',
+            BASE_DIR / 'xml_NFs',
+        ]
+        
+        for diretorio in diretorios:
+            if diretorio.exists():
+                print(f"    📂 Verificando diretório legado: {diretorio}")
+                for pdf_file in diretorio.rglob(f"*{chave}*.pdf"):
+                    print(f"    ✅ Arquivo encontrado: {pdf_file}")
+                    return pdf_file
+        
+        print(f"    ❌ PDF não encontrado em nenhum local")
+        return None
 
-        dialog.exec_()
+    def abrir_relatorio(self):
+        """Abre diálogo de relatório analítico IBS/CBS com filtros de período e empresa."""
+        from modules.relatorios import RELATORIO_IBS_CBS
+        self._abrir_relatorio_sql(RELATORIO_IBS_CBS, "Relatório IBS/CBS", escopo='destinatario',
+                                  filtro_tipo=False, tamanho=(1400, 800))
 
-    def abrir_relatorio_notas(self):
-        """Abre relatório completo de notas da empresa selecionada."""
-        from PyQt5.QtWidgets import (
-            QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
-            QTableWidget, QTableWidgetItem, QHeaderView, QComboBox,
-            QDateEdit, QProgressDialog, QFileDialog, QMessageBox
+    def _abrir_relatorio_sql(self, relatorio, titulo, escopo, filtro_tipo, tamanho):
+        """
+        Diálogo comum dos relatórios (modules/relatorios): consulta SQL sobre
+        as colunas tipadas, tabela paginada (RelatorioTableModel), totais e
+        agrupamentos calculados no banco e exportação em fluxo (xlsx/CSV).
+        """
+        from PyQt5.QtWidgets import QTableView
+        from PyQt5.QtCore import QDate
+        from modules.relatorios import (
+            AGRUPAMENTOS, FiltroRelatorio, exportar_csv, exportar_xlsx, relatorio_agrupado, totais,
         )
-        from PyQt5.QtCore import Qt, QDate
-        from PyQt5.QtGui import QColor
-        from datetime import datetime
 
         try:
             dialog = QDialog(self)
-            dialog.setWindowTitle("Relatório de Notas")
-            dialog.resize(1500, 850)
+            dialog.setWindowTitle(titulo)
+            dialog.resize(*tamanho)
             layout = QVBoxLayout(dialog)
 
-            # ── Filtros ──────────────────────────────────────────────────────
-            filtro_layout = QHBoxLayout()
+            # === FILTROS ===
+            filter_layout = QHBoxLayout()
 
-            filtro_layout.addWidget(QLabel("De:"))
-            date_inicio = QDateEdit()
-            date_inicio.setCalendarPopup(True)
-            date_inicio.setDate(QDate.currentDate().addMonths(-1))
+            filter_layout.addWidget(QLabel("Período:"))
+            date_inicio = QDateEdit(QDate.currentDate().addMonths(-1))
             date_inicio.setDisplayFormat("dd/MM/yyyy")
-            filtro_layout.addWidget(date_inicio)
-
-            filtro_layout.addWidget(QLabel("Até:"))
-            date_fim = QDateEdit()
-            date_fim.setCalendarPopup(True)
-            date_fim.setDate(QDate.currentDate())
+            date_inicio.setCalendarPopup(True)
+            date_fim = QDateEdit(QDate.currentDate())
             date_fim.setDisplayFormat("dd/MM/yyyy")
-            filtro_layout.addWidget(date_fim)
+            date_fim.setCalendarPopup(True)
+            filter_layout.addWidget(date_inicio)
+            filter_layout.addWidget(QLabel("até"))
+            filter_layout.addWidget(date_fim)
 
-            filtro_layout.addWidget(QLabel("Empresa:"))
+            filter_layout.addWidget(QLabel("Empresa:"))
             combo_empresa = QComboBox()
-            combo_empresa.setMinimumWidth(260)
-            filtro_layout.addWidget(combo_empresa)
+            combo_empresa.setMinimumWidth(250)
+            filter_layout.addWidget(combo_empresa)
 
-            filtro_layout.addWidget(QLabel("Tipo:"))
-            combo_tipo = QComboBox()
-            combo_tipo.addItem("Todos", None)
-            combo_tipo.addItem("NF-e", "NFE")
-            combo_tipo.addItem("CT-e", "CTE")
-            combo_tipo.addItem("NFS-e", "NFSE")
-            filtro_layout.addWidget(combo_tipo)
+            combo_tipo = None
+            if filtro_tipo:
+                filter_layout.addWidget(QLabel("Tipo:"))
+                combo_tipo = QComboBox()
+                combo_tipo.addItem("Todos", None)
+                combo_tipo.addItem("NF-e", "NFE")
+                combo_tipo.addItem("CT-e", "CTE")
+                combo_tipo.addItem("NFS-e", "NFSE")
+                filter_layout.addWidget(combo_tipo)
+
+            filter_layout.addWidget(QLabel("Agrupar:"))
+            combo_agrupar = QComboBox()
+            combo_agrupar.addItem("Nota a nota", None)
+            for chave_agr, (rotulo, _) in AGRUPAMENTOS.items():
+                combo_agrupar.addItem(f"Por {rotulo.lower()}", chave_agr)
+            filter_layout.addWidget(combo_agrupar)
 
             btn_atualizar = QPushButton("🔄 Atualizar")
-            btn_atualizar.setMinimumWidth(100)
-            filtro_layout.addWidget(btn_atualizar)
-
-            btn_exportar = QPushButton("📊 Exportar Excel")
-            btn_exportar.setMinimumWidth(130)
-            btn_exportar.setEnabled(False)
-            filtro_layout.addWidget(btn_exportar)
-
-            filtro_layout.addStretch()
-            layout.addLayout(filtro_layout)
-
-            # ── Tabela ───────────────────────────────────────────────────────
-            colunas = ["Nº", "Tipo", "Data Emissão", "Emitente", "CNPJ Emitente",
-                       "Destinatário", "CNPJ Dest.", "Valor Total", "IBS", "CBS",
-                       "Status", "Chave"]
-            table = QTableWidget(0, len(colunas))
-            table.setHorizontalHeaderLabels(colunas)
+            btn_exportar_excel = QPushButton("📊 Exportar Excel")
+            btn_exportar_csv = QPushButton("📄 Exportar CSV")
+            btn_exportar_excel.setEnabled(False)
+            btn_exportar_csv.setEnabled(False)
+            filter_layout.addWidget(btn_atualizar)
+            filter_layout.addWidget(btn_exportar_excel)
+            filter_layout.addWidget(btn_exportar_csv)
+            filter_layout.addStretch()
+            layout.addLayout(filter_layout)
+
+            # === TABELA (paginada: só as linhas roladas saem do banco) ===
+            table = QTableView()
+            modelo = RelatorioTableModel(table)
+            table.setModel(modelo)
             table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
             table.horizontalHeader().setStretchLastSection(True)
-            table.setSelectionBehavior(QTableWidget.SelectRows)
-            table.setEditTriggers(QTableWidget.NoEditTriggers)
+            table.setSelectionBehavior(QAbstractItemView.SelectRows)
+            table.setSelectionMode(QAbstractItemView.ExtendedSelection)  # Permite múltipla seleção
+            table.setEditTriggers(QAbstractItemView.NoEditTriggers)
             table.setAlternatingRowColors(True)
-            table.setSortingEnabled(True)
-            # Larguras iniciais
-            for col, w in [(0, 80), (1, 60), (2, 95), (3, 200), (4, 130),
-                           (5, 200), (6, 130), (7, 105), (8, 90), (9, 90),
-                           (10, 100)]:
-                table.setColumnWidth(col, w)
+            table.setSortingEnabled(True)  # Ordena no banco (RelatorioTableModel.sort)
             layout.addWidget(table)
 
-            # ── Rodapé ───────────────────────────────────────────────────────
-            rodape = QHBoxLayout()
-            lbl_status = QLabel("")
-            rodape.addWidget(lbl_status, 1)
-            lbl_totais_rel = QLabel("")
-            lbl_totais_rel.setStyleSheet("font-weight: bold; padding-left: 12px;")
-            rodape.addWidget(lbl_totais_rel)
-            layout.addLayout(rodape)
-
-            # ── Helpers ──────────────────────────────────────────────────────
-            def fmt_moeda(v):
-                try:
-                    return f"R$ {float(v):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                except Exception:
-                    return "R$ 0,00"
-
-            def atualizar_totais_rel():
-                selecionadas = table.selectedItems()
-                linhas = {item.row() for item in selecionadas}
-                if not linhas:
-                    linhas = set(range(table.rowCount()))
-                total_valor = ibs_total = cbs_total = 0.0
-                for r in linhas:
-                    def _cel(c):
-                        it = table.item(r, c)
-                        return it.text() if it else ""
-                    try:
-                        total_valor += float(_cel(7).replace("R$", "").replace(".", "").replace(",", ".").strip() or 0)
-                    except Exception:
-                        pass
-                    try:
-                        ibs_total += float(_cel(8).replace("R$", "").replace(".", "").replace(",", ".").strip() or 0)
-                    except Exception:
-                        pass
-                    try:
-                        cbs_total += float(_cel(9).replace("R$", "").replace(".", "").replace(",", ".").strip() or 0)
-                    except Exception:
-                        pass
-                lbl_totais_rel.setText(
-                    f"Docs: {len(linhas)} | Valor: {fmt_moeda(total_valor)} | "
-                    f"IBS: {fmt_moeda(ibs_total)} | CBS: {fmt_moeda(cbs_total)}"
+            lbl_status = QLabel("Selecione o período e clique em Atualizar")
+            layout.addWidget(lbl_status)
+
+            lbl_totais = QLabel("")
+            lbl_totais.setStyleSheet("QLabel { background-color: #f0f0f0; padding: 8px; font-weight: bold; border: 1px solid #ccc; }")
+            layout.addWidget(lbl_totais)
+
+            # Conexão própria do diálogo (cursor da paginação fica aberto enquanto ele existir)
+            conn = self.db._connect()
+            estado = {'filtro': None, 'totais': None}
+
+            # === FUNÇÕES AUXILIARES ===
+
+            def filtro_atual():
+                return FiltroRelatorio(
+                    date_inicio.date().toString("yyyy-MM-dd"),
+                    date_fim.date().toString("yyyy-MM-dd"),
+                    cnpj=combo_empresa.currentData(),
+                    tipo=combo_tipo.currentData() if combo_tipo else None,
+                    escopo=escopo,
                 )
 
-            def popular_empresas_notas():
-                combo_empresa.clear()
-                combo_empresa.addItem("Todas as empresas", None)
+            def relatorio_atual():
+                por = combo_agrupar.currentData()
+                return relatorio_agrupado(por) if por else relatorio
+
+            def texto_totais(prefixo, docs, valor, ibs, cbs):
+                return (f"{prefixo}: {docs} documento(s)  |  Total Valor: {formatar_centavos(valor)}  |  "
+                        f"Total IBS: {formatar_centavos(ibs)}  |  Total CBS: {formatar_centavos(cbs)}")
+
+            def atualizar_totais():
+                """Totais da seleção (valores crus do modelo) ou do filtro inteiro (SUM no banco)."""
+                t = estado['totais']
+                if t is None:
+                    lbl_totais.setText("")
+                    return
+                linhas = {i.row() for i in table.selectionModel().selectedRows()}
+                rel = modelo.relatorio
+                if not linhas or rel is None:
+                    lbl_totais.setText(texto_totais("Período", t['documentos'], t['valor'], t['ibs'], t['cbs']))
+                    return
+                idx = {c.titulo: i for i, c in enumerate(rel.colunas)}
+                soma = {nome: sum((modelo.linha(r)[idx[nome]] or 0) for r in linhas)
+                        for nome in ("Valor Total", "IBS", "CBS")}
+                docs = (sum(modelo.linha(r)[idx["Documentos"]] or 0 for r in linhas)
+                        if "Documentos" in idx else len(linhas))
+                lbl_totais.setText(texto_totais("Selecionados", docs, soma["Valor Total"], soma["IBS"], soma["CBS"]))
+
+            def popular_empresas():
+                """Empresas dos certificados; sem certificados, os destinatários das notas."""
                 try:
-                    with self.db._connect() as conn:
-                        cursor = conn.execute("PRAGMA table_info(certificados)")
-                        cols = {c[1] for c in cursor.fetchall()}
-                        nome_col = "razao_social" if "razao_social" in cols else (
-                            "nome_certificado" if "nome_certificado" in cols else "informante")
-                        ativo_clause = "WHERE ativo = 1" if "ativo" in cols else ""
-                        cursor = conn.execute(
-                            f"SELECT cnpj_cpf, {nome_col} FROM certificados {ativo_clause} ORDER BY {nome_col}"
-                        )
-                        for cnpj, nome in cursor.fetchall():
+                    combo_empresa.clear()
+                    combo_empresa.addItem("Todas as empresas", None)
+                    cols = {c[1] for c in conn.execute("PRAGMA table_info(certificados)").fetchall()}
+                    nome_col = "razao_social" if "razao_social" in cols else (
+                        "nome_certificado" if "nome_certificado" in cols else "informante")
+                    ativo_clause = "WHERE ativo = 1" if "ativo" in cols else ""
+                    empresas = conn.execute(
+                        f"SELECT cnpj_cpf, {nome_col} FROM certificados {ativo_clause} ORDER BY {nome_col}"
+                    ).fetchall()
+                    if empresas:
+                        for cnpj, nome in empresas:
                             if cnpj:
-                                combo_empresa.addItem(f"{cnpj} – {nome or 'Sem Nome'}", cnpj)
-                except Exception:
-                    pass
+                                combo_empresa.addItem(f"{cnpj} - {nome or 'Sem Nome'}", cnpj)
+                    else:
+                        for (cnpj,) in conn.execute(
+                                "SELECT DISTINCT cnpj_destinatario FROM notas_detalhadas "
+                                "WHERE cnpj_destinatario IS NOT NULL ORDER BY cnpj_destinatario"):
+                            if cnpj:
+                                combo_empresa.addItem(cnpj, cnpj)
+                except Exception as e:
+                    QMessageBox.warning(dialog, "Erro", f"Erro ao carregar empresas: {e}")
                 # Pre-seleciona certificado ativo se houver
                 cert_atual = getattr(self, '_selected_cert_cnpj', None)
                 if cert_atual:
@@ -15339,162 +14755,177 @@ class MainWindow(QMainWindow):
                             combo_empresa.setCurrentIndex(i)
                             break
 
-            def atualizar_relatorio_notas():
-                table.setRowCount(0)
-                btn_exportar.setEnabled(False)
-                lbl_totais_rel.setText("")
-                lbl_status.setText("Buscando...")
-                dialog.repaint()
-
-                data_ini = date_inicio.date().toString("yyyy-MM-dd")
-                data_fim = date_fim.date().toString("yyyy-MM-dd")
-                cnpj_filtro = combo_empresa.currentData()
-                tipo_filtro = combo_tipo.currentData()
-
+            def atualizar_relatorio():
+                """Refaz a consulta com os filtros atuais (primeira página + totais no banco)."""
                 try:
-                    query = """
-                        SELECT numero, tipo, data_emissao, nome_emitente, cnpj_emitente,
-                               nome_destinatario, cnpj_destinatario, valor, v_ibs, v_cbs,
-                               status, chave
-                        FROM notas_detalhadas
-                        WHERE data_emissao BETWEEN ? AND ?
-                    """
-                    params = [data_ini, data_fim]
-
-                    if cnpj_filtro:
-                        query += " AND (cnpj_destinatario = ? OR cnpj_emitente = ? OR informante = ?)"
-                        params.extend([cnpj_filtro, cnpj_filtro, cnpj_filtro])
-
-                    if tipo_filtro:
-                        if tipo_filtro == "NFSE":
-                            query += " AND tipo LIKE '%NFS%'"
-                        else:
-                            query += " AND UPPER(REPLACE(REPLACE(tipo,'-',''),' ','')) = ?"
-                            params.append(tipo_filtro)
+                    btn_exportar_excel.setEnabled(False)
+                    btn_exportar_csv.setEnabled(False)
+                    filtro = filtro_atual()
+                    estado['filtro'] = filtro
+                    estado['totais'] = t = totais(conn, filtro)
+                    if not t['documentos']:
+                        modelo.limpar()
+                        estado['totais'] = None
+                        lbl_totais.setText("")
+                        lbl_status.setText("Nenhum documento encontrado no período selecionado")
+                        return
 
-                    query += " ORDER BY data_emissao DESC, numero DESC"
+                    modelo.carregar(conn, relatorio_atual(), filtro)
+                    table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+                    for col, coluna in enumerate(modelo.relatorio.colunas):
+                        table.setColumnWidth(col, coluna.largura * 8)
 
-                    with self.db._connect() as conn:
-                        rows = conn.execute(query, params).fetchall()
+                    status_msg = f"✅ Relatório gerado: {t['documentos']} documento(s)"
+                    if t['sem_ibs_cbs']:
+                        # Notas antigas gravadas antes das colunas IBS/CBS e sem índice em nfe_docs
+                        status_msg += f" | ⚠️ {t['sem_ibs_cbs']} nota(s) sem IBS/CBS no banco"
+                        status_msg += " | 💡 Execute 'Atualizar IBS/CBS' no menu (Ctrl+Shift+U)"
+                    lbl_status.setText(status_msg)
+                    btn_exportar_excel.setEnabled(True)
+                    btn_exportar_csv.setEnabled(True)
+                    atualizar_totais()
+                except Exception as e:
+                    QMessageBox.critical(dialog, "Erro", f"Erro ao gerar relatório: {e}")
+                    import traceback
+                    traceback.print_exc()
 
-                    if not rows:
-                        lbl_status.setText("Nenhum documento encontrado no período selecionado.")
+            def exportar(formato):
+                """Exporta o filtro atual em segundo plano, direto do banco para o arquivo."""
+                filtro = estado['filtro']
+                if filtro is None or not estado['totais']:
+                    QMessageBox.warning(dialog, "Aviso", "Não há dados para exportar")
+                    return
+                if formato == 'xlsx':
+                    try:
+                        import openpyxl  # noqa: F401
+                    except ImportError:
+                        QMessageBox.critical(dialog, "Erro",
+                                             "Biblioteca openpyxl não instalada.\n\n"
+                                             "Execute: pip install openpyxl\n\nOu use Exportar CSV.")
                         return
+                data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
+                base = relatorio.nome.replace(" ", "_").replace("Relatório", "Relatorio")
+                rotulo = "Excel Files (*.xlsx)" if formato == 'xlsx' else "CSV (*.csv)"
+                arquivo, _ = QFileDialog.getSaveFileName(dialog, "Salvar Relatório", f"{base}_{data_hora}.{formato}", rotulo)
+                if not arquivo:
+                    return
 
-                    progress = QProgressDialog("Preenchendo tabela...", "Cancelar", 0, len(rows), dialog)
-                    progress.setWindowTitle("Relatório de Notas")
-                    progress.setWindowModality(Qt.WindowModal)
-                    progress.show()
-
-                    table.setSortingEnabled(False)
-                    table.setRowCount(len(rows))
+                rel = relatorio_atual()
+                por = combo_agrupar.currentData()
+                db = self.db
 
-                    for idx, row in enumerate(rows):
-                        if progress.wasCanceled():
-                            break
-                        (numero, tipo, data_emissao, nome_emit, cnpj_emit,
-                         nome_dest, cnpj_dest, valor, v_ibs, v_cbs, status, chave) = row
+                class ExportarRelatorioWorker(QThread):
+                    progresso = pyqtSignal(int)
+                    concluido = pyqtSignal(int)
+                    erro = pyqtSignal(str)
 
+                    def run(self):
                         try:
-                            data_fmt = datetime.strptime(data_emissao, "%Y-%m-%d").strftime("%d/%m/%Y")
-                        except Exception:
-                            data_fmt = data_emissao or ""
+                            with db._connect() as conn_exp:
+                                if formato == 'xlsx':
+                                    # Nota a nota + aba de resumo mensal (e do agrupamento escolhido)
+                                    agrupamentos = ['mes'] + ([por] if por and por != 'mes' else [])
+                                    n = exportar_xlsx(conn_exp, relatorio, filtro, arquivo,
+                                                      agrupamentos=agrupamentos,
+                                                      progresso=self.progresso.emit,
+                                                      cancelado=self.isInterruptionRequested)
+                                else:
+                                    n = exportar_csv(conn_exp, rel, filtro, arquivo,
+                                                     progresso=self.progresso.emit,
+                                                     cancelado=self.isInterruptionRequested)
+                            self.concluido.emit(n)
+                        except InterruptedError:
+                            self.concluido.emit(-1)
+                        except Exception as e:
+                            import traceback
+                            traceback.print_exc()
+                            self.erro.emit(str(e))
 
-                        try:
-                            valor_f = float(valor) if valor else 0.0
-                        except Exception:
-                            valor_f = 0.0
-                        try:
-                            ibs_f = float(v_ibs) if v_ibs is not None else 0.0
-                        except Exception:
-                            ibs_f = 0.0
-                        try:
-                            cbs_f = float(v_cbs) if v_cbs is not None else 0.0
-                        except Exception:
-                            cbs_f = 0.0
+                total = estado['totais']['documentos'] if formato == 'xlsx' or not por else 0
+                progress = QProgressDialog("Exportando relatório...", "Cancelar", 0, total, dialog)
+                progress.setWindowTitle("Exportar")
+                progress.setWindowModality(Qt.WindowModal)
+                progress.setMinimumDuration(0)
+                progress.setAutoClose(False)
+                progress.setAutoReset(False)
+                progress.show()
 
-                        vals = [numero or "", tipo or "", data_fmt,
-                                nome_emit or "", cnpj_emit or "",
-                                nome_dest or "", cnpj_dest or "",
-                                fmt_moeda(valor_f), fmt_moeda(ibs_f), fmt_moeda(cbs_f),
-                                status or "", chave or ""]
-                        for col, val in enumerate(vals):
-                            table.setItem(idx, col, QTableWidgetItem(val))
+                worker = ExportarRelatorioWorker()
+                dialog._exportar_worker = worker
 
-                        if idx % 100 == 0 or idx == len(rows) - 1:
-                            progress.setValue(idx)
+                def _on_progresso(n):
+                    progress.setValue(min(n, progress.maximum()) if progress.maximum() else 0)
+                    progress.setLabelText(f"Exportando... {n} linha(s)")
 
-                    progress.setValue(len(rows))
-                    table.setSortingEnabled(True)
-                    lbl_status.setText(f"✅ {len(rows)} documento(s) encontrado(s)")
-                    btn_exportar.setEnabled(True)
-                    atualizar_totais_rel()
+                def _on_concluido(n):
+                    progress.close()
+                    if n < 0:
+                        QMessageBox.information(dialog, "Exportar", "Exportação cancelada.")
+                    else:
+                        QMessageBox.information(dialog, "Sucesso",
+                                                f"Relatório exportado com sucesso!\n\n{n} linha(s)\n{arquivo}")
 
-                except Exception as e:
-                    QMessageBox.critical(dialog, "Erro", f"Erro ao gerar relatório: {e}")
-                    import traceback; traceback.print_exc()
+                def _on_erro(mensagem):
+                    progress.close()
+                    QMessageBox.critical(dialog, "Erro", f"Erro ao exportar: {mensagem}")
 
-            def exportar_excel_notas():
-                if table.rowCount() == 0:
-                    QMessageBox.warning(dialog, "Aviso", "Não há dados para exportar.")
-                    return
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                arquivo, _ = QFileDialog.getSaveFileName(
-                    dialog, "Salvar Relatório Excel",
-                    f"Relatorio_Notas_{ts}.xlsx", "Excel Files (*.xlsx)"
-                )
-                if not arquivo:
-                    return
-                try:
-                    from openpyxl import Workbook
-                    from openpyxl.styles import Font, Alignment, PatternFill
-                except ImportError:
-                    QMessageBox.critical(dialog, "Erro",
-                        "Biblioteca openpyxl não instalada.\n\nExecute: pip install openpyxl")
-                    return
-                try:
-                    wb = Workbook()
-                    ws = wb.active
-                    ws.title = "Relatório de Notas"
-                    headers = [table.horizontalHeaderItem(i).text() for i in range(table.columnCount())]
-                    ws.append(headers)
-                    hfill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                    for cell in ws[1]:
-                        cell.fill = hfill
-                        cell.font = Font(color="FFFFFF", bold=True)
-                        cell.alignment = Alignment(horizontal="center")
-                    for r in range(table.rowCount()):
-                        row_data = [
-                            (table.item(r, c).text() if table.item(r, c) else "")
-                            for c in range(table.columnCount())
-                        ]
-                        ws.append(row_data)
-                    # Alinha colunas monetárias à direita (Valor, IBS, CBS = cols 8,9,10)
-                    for r in range(2, ws.max_row + 1):
-                        for c in [8, 9, 10]:
-                            ws.cell(row=r, column=c).alignment = Alignment(horizontal="right")
-                    for col in ws.columns:
-                        max_len = max((len(str(cell.value or "")) for cell in col), default=10)
-                        ws.column_dimensions[col[0].column_letter].width = min(max_len + 2, 50)
-                    wb.save(arquivo)
-                    QMessageBox.information(dialog, "Sucesso", f"Relatório exportado!\n\n{arquivo}")
-                except Exception as e:
-                    QMessageBox.critical(dialog, "Erro", f"Erro ao exportar: {e}")
-                    import traceback; traceback.print_exc()
+                progress.canceled.connect(worker.requestInterruption)
+                worker.progresso.connect(_on_progresso)
+                worker.concluido.connect(_on_concluido)
+                worker.erro.connect(_on_erro)
+                worker.finished.connect(worker.deleteLater)
+                worker.start()
 
-            # ── Sinais ───────────────────────────────────────────────────────
-            btn_atualizar.clicked.connect(atualizar_relatorio_notas)
-            btn_exportar.clicked.connect(exportar_excel_notas)
-            table.itemSelectionChanged.connect(atualizar_totais_rel)
+            # === CONECTA SINAIS ===
+            btn_atualizar.clicked.connect(atualizar_relatorio)
+            btn_exportar_excel.clicked.connect(lambda: exportar('xlsx'))
+            btn_exportar_csv.clicked.connect(lambda: exportar('csv'))
+            combo_agrupar.currentIndexChanged.connect(lambda _: estado['filtro'] is not None and atualizar_relatorio())
+            table.selectionModel().selectionChanged.connect(lambda *_: atualizar_totais())
+            modelo.modelReset.connect(atualizar_totais)
 
-            popular_empresas_notas()
-            dialog.exec_()
+            popular_empresas()
+            try:
+                dialog.exec_()
+            finally:
+                modelo.limpar()
+                conn.close()
 
         except Exception as e:
-            QMessageBox.critical(self, "Erro", f"Erro ao abrir relatório de notas: {e}")
+            QMessageBox.critical(self, "Erro", f"Erro ao abrir relatório: {e}")
             import traceback
             traceback.print_exc()
 
+    def abrir_relatorios_menu(self):
+        """Abre menu de seleção de relatórios."""
+        from PyQt5.QtWidgets import QDialog, QVBoxLayout, QPushButton, QLabel
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Relatórios")
+        dialog.setFixedSize(340, 160)
+        layout = QVBoxLayout(dialog)
+        layout.setSpacing(10)
+        layout.addWidget(QLabel("<b>Selecione o relatório desejado:</b>"))
+
+        btn_ibs = QPushButton("💰  Relatório IBS/CBS")
+        btn_ibs.setMinimumHeight(42)
+        btn_ibs.setToolTip("Relatório analítico com IBS e CBS por nota fiscal")
+        btn_ibs.clicked.connect(lambda: (dialog.accept(), self.abrir_relatorio()))
+        layout.addWidget(btn_ibs)
+
+        btn_notas = QPushButton("📄  Relatório de Notas")
+        btn_notas.setMinimumHeight(42)
+        btn_notas.setToolTip("Relatório de todas as notas da empresa: número, valor e impostos")
+        btn_notas.clicked.connect(lambda: (dialog.accept(), self.abrir_relatorio_notas()))
+        layout.addWidget(btn_notas)
+
+        dialog.exec_()
+
+    def abrir_relatorio_notas(self):
+        """Abre relatório completo de notas da empresa selecionada."""
+        from modules.relatorios import RELATORIO_NOTAS
+        self._abrir_relatorio_sql(RELATORIO_NOTAS, "Relatório de Notas", escopo='envolvida',
+                                  filtro_tipo=True, tamanho=(1500, 850))
+
     def do_busca_completa(self):
         """Busca completa: reseta NSU para 0 e busca todos os XMLs da SEFAZ."""
         from datetime import datetime, timedelta
@@ -16060,6 +15491,7 @@ class MainWindow(QMainWindow):
             
             # 1. Limpar tabelas da interface (Recebidas E Emitidas)
             self.notes = []
+            self._linhas_por_chave = {}
             self.table.clearContents()
             self.table.setRowCount(0)
             
@@ -16231,29 +15663,11 @@ class MainWindow(QMainWindow):
                     primeira_chave = docs[0].get('chave', '') if docs else ''
                     self.parent.db.save_sync_state(primeira_chave, total, 0)
                     
-                    # Extrai chaves dos documentos (pula eventos e já cancelados)
-                    chaves_para_consultar = []
-                    eventos_pulados = 0
-                    cancelados_pulados = 0
-                    
-                    for item in docs:
-                        chave = item.get('chave', '')
-                        xml_status = (item.get('xml_status') or '').upper()
-                        
-                        # Debug: conta eventos
-                        if xml_status == 'EVENTO':
-                            eventos_pulados += 1
-                            continue
-                        
-                        # Pula eventos e documentos já cancelados
-                        if chave and len(chave) == 44:
-                            if self.parent.db.is_chave_cancelada(chave):
-                                cancelados_pulados += 1
-                            else:
-                                chaves_para_consultar.append(chave)
-                    
-                    print(f"[SYNC] Eventos pulados: {eventos_pulados}")
-                    print(f"[SYNC] Já cancelados pulados: {cancelados_pulados}")
+                    # Só as chaves com verificação vencida na agenda: eventos, canceladas e
+                    # notas fora do prazo de eventos ficam de fora (modules/agenda_status)
+                    chaves_para_consultar = self.parent.db.chaves_status_devidas(limite=None)
+                    print(f"[SYNC] Fora da agenda (finais, eventos ou ainda não vencidas): "
+                          f"{total - len(chaves_para_consultar)}")
                     print(f"[SYNC] Chaves para consultar: {len(chaves_para_consultar)}")
                     
                     if not chaves_para_consultar:
@@ -20656,7 +20070,7 @@ class AutofillWorker(QThread):
                 self._emit(f"[Autofill] {idx}/{len(self.items)} chave={chave}")
 
                 # 1) Tenta XML local
-                xml_text = resolve_xml_text(item)
+                xml_text = resolve_xml_text(item, usar_cache=False)
                 # 2) Se não encontrou, tenta SEFAZ via sandbox com os certificados
                 if not xml_text:
                     # Prioriza certificado do informante quando possível
@@ -20730,7 +20144,7 @@ class ExportDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("📤 Exportar Arquivos")
-        self.resize(500, 400)
+        self.resize(500, 520)
         
         # Estilo moderno
         self.setStyleSheet("""
@@ -20829,6 +20243,29 @@ class ExportDialog(QDialog):
         layout_nome.addWidget(label_explicacao)
         grupo_nome.setLayout(layout_nome)
         layout.addWidget(grupo_nome)
+
+        # Grupo: Destino (pasta ou um único .zip) e organização das subpastas
+        grupo_destino = QGroupBox("📦 Destino")
+        layout_destino = QVBoxLayout()
+
+        self.radio_destino_pasta = QRadioButton("Pasta (arquivos soltos)")
+        self.radio_destino_zip = QRadioButton("Arquivo ZIP único")
+        self.radio_destino_pasta.setChecked(True)  # Padrão
+
+        linha_layout = QHBoxLayout()
+        linha_layout.addWidget(QLabel("Organizar em subpastas:"))
+        self.combo_layout = QComboBox()
+        for rotulo, chave_layout in (("Todos na mesma pasta", 'plano'), ("Por mês de emissão", 'mes'),
+                                     ("Por CNPJ do emitente", 'emitente'), ("Por tipo de documento", 'tipo'),
+                                     ("Por mês e tipo", 'mes_tipo')):
+            self.combo_layout.addItem(rotulo, chave_layout)
+        linha_layout.addWidget(self.combo_layout, 1)
+
+        layout_destino.addWidget(self.radio_destino_pasta)
+        layout_destino.addWidget(self.radio_destino_zip)
+        layout_destino.addLayout(linha_layout)
+        grupo_destino.setLayout(layout_destino)
+        layout.addWidget(grupo_destino)
         
         # Espaçador
         layout.addStretch()
@@ -20858,7 +20295,9 @@ class ExportDialog(QDialog):
         return {
             'exportar_xml': self.radio_xml.isChecked() or self.radio_ambos.isChecked(),
             'exportar_pdf': self.radio_pdf.isChecked() or self.radio_ambos.isChecked(),
-            'nome_personalizado': self.radio_nome_personalizado.isChecked()
+            'nome_personalizado': self.radio_nome_personalizado.isChecked(),
+            'formato': 'zip' if self.radio_destino_zip.isChecked() else 'pasta',
+            'layout': self.combo_layout.currentData() or 'plano',
         }
 
 
@@ -22316,5 +21755,8 @@ def main():
 
 
 if __name__ == "__main__":
+    # Executável congelado: os processos do pool de PDFs (modules/pdf_lote) reentram por aqui
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
 
@@ -52,6 +52,12 @@ if (ROOT / 'Arquivo_xsd').exists():
 else:
     print("[SPEC] AVISO: Pasta Arquivo_xsd nao encontrada")
 
+if (ROOT / 'Arquivo_wsdl' / 'manifesto.json').exists():
+    added_files.append((str(ROOT / 'Arquivo_wsdl'), 'Arquivo_wsdl'))
+    print("[SPEC] OK: Arquivo_wsdl incluido")
+else:
+    print("[SPEC] AVISO: Arquivo_wsdl ausente (gere com scripts/atualizar_wsdl_embarcado.py)")
+
 if (ROOT / 'Icone' / 'Logo.ico').exists():
     added_files.append((str(ROOT / 'Icone' / 'Logo.ico'), '.'))
     print("[SPEC] OK: Logo.ico incluido")
@@ -133,6 +139,31 @@ hidden_imports = [
     'modules.ui_components',           # Helpers UI
     'modules.xsd_validator',           # Validação XSD
     'modules.task_manager_dialog',     # Dialog gestão de tarefas
+    'modules.payload_codec',           # XML/JSON compactados no notas.db
+    'modules.arquivo_mensal',          # ZIP mensal de XMLs (armazenamento frio)
+    'modules.schema_migrations',       # schema_version + migrações do notas.db
+    'modules.colunas_normalizadas',    # centavos/data ISO em notas_detalhadas
+    'modules.nfse_busca_concorrente',  # NSU NFS-e em janela concorrente (AIMD)
+    'modules.nfse_abrasf_incremental', # watermark de data da consulta ABRASF
+    'modules.danfse_prefetch',         # pré-download do DANFSe oficial
+    'modules.agenda_status',           # agenda de verificação de eventos por chave
+    'modules.consulta_protocolo_lote', # consulta de protocolo em lote por UF/modelo
+    'modules.saude_endpoints',         # disjuntor/latência por endpoint + contingência
+    'modules.wsdl_cache',              # WSDL/XSD persistidos para o zeep (offline)
+    'modules.fila_offline',            # pedidos feitos offline, refeitos quando a SEFAZ volta
+    'modules.busca_chaves_lote',       # busca por chave em lote, certificados em paralelo
+    'modules.download_resumos',        # Ciência + download dos resumos em pipeline
+    'modules.pdf_lote',                # DANFE/DACTE em lote (pool de processos)
+    'modules.pdf_combinado',           # PDF único das notas selecionadas (impressão)
+    'modules.exportacao_lote',         # exportação em lote para ZIP/pasta (leitura paralela)
+    'modules.relatorios',              # relatórios IBS/CBS e de notas em SQL (exportação em fluxo)
+    'modules.backfill_ibs_cbs',        # preenchimento de IBS/CBS em segundo plano (pool + checkpoint)
+    'modules.pdf_especulativo',        # pré-geração de PDFs das linhas visíveis/recentes (processo ocioso)
+    'modules.documento_cache',         # LRU de XMLs lidos/parseados (PDF, eventos, cancelamento)
+    'modules.eventos_index',           # tabela eventos (chave/tpEvento/nSeqEvento) e varredura única
+    'modules.doc_links',               # vínculos CT-e/NF-e/eventos (painel Documentos relacionados)
+    'modules.nfe_itens',               # itens das NF-e (tabela nfe_itens, análise por NCM/CFOP)
+    'modules.trabalho_paginado',       # base dos trabalhos em segundo plano (páginas, checkpoint, pool)
     'gerar_danfse_profissional',  # Gerador DANFSe profissional (v1.1.16)
     'qrcode',  # Dependência do gerar_danfse_profissional
     'qrcode.image',  # Módulo de imagem do qrcode
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Agenda de verificação de eventos (status) por chave.
+
+Consultar os eventos de TODA nota "autorizada" a cada atualização gasta a
+cota da SEFAZ (20 consultas/hora por chave) e horas de relógio com notas que
+já não podem mudar. A tabela status_agenda guarda, por chave:
+
+    last_checked  epoch da última consulta bem-sucedida
+    next_check    epoch a partir do qual a chave volta a ser consultada
+    final         1 = estado definitivo (cancelada ou prazo de eventos vencido)
+
+Regras:
+    - O intervalo cresce com a idade do documento: 1/4 da idade, entre 1 h e
+      7 dias (nota de hoje → de hora em hora; nota de 3 semanas → a cada ~5 dias).
+    - Passado o prazo dos eventos que alteram o status (cancelamento,
+      inclusive extemporâneo, e carta de correção) a chave fica final; a
+      última consulta é agendada exatamente no fim do prazo.
+    - Cancelada / denegada → final, nunca mais consultada.
+    - Erro na consulta → nova tentativa em 1 h, sem mexer em last_checked.
+
+chaves_devidas() devolve o próximo lote para atualizar_status_notas_lote().
+"""
+from __future__ import annotations
+
+import sqlite3
+import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+HORA = 3600
+DIA = 24 * HORA
+
+# Prazo (a partir da emissão) em que ainda podem surgir eventos que mudam o status
+PRAZO_EVENTOS = {
+    '55': 30 * DIA,   # NF-e: cancelamento (24 h, extemporâneo em algumas UFs) e CC-e (30 dias)
+    '65': 2 * DIA,    # NFC-e: cancelamento (30 min) / substituição
+    '57': 45 * DIA,   # CT-e: cancelamento (7 dias) e CC-e
+}
+PRAZO_PADRAO = 30 * DIA
+
+INTERVALO_MINIMO = HORA
+INTERVALO_MAXIMO = 7 * DIA
+FRACAO_IDADE = 0.25
+ESPERA_APOS_ERRO = HORA
+
+# Resultados de atualizar_status_notas_lote que encerram a agenda da chave
+RESULTADOS_FINAIS = ('cancelada',)
+
+
+def prazo_eventos(chave: str) -> int:
+    return PRAZO_EVENTOS.get(chave[20:22] if len(chave) == 44 else '', PRAZO_PADRAO)
+
+
+def proxima_verificacao(chave: str, emissao_epoch: Optional[int], agora: int) -> Optional[int]:
+    """Epoch da próxima consulta ou None quando a chave não pode mais mudar."""
+    if not emissao_epoch:
+        return agora + DIA
+    prazo = emissao_epoch + prazo_eventos(chave)
+    if agora >= prazo:
+        return None
+    idade = max(0, agora - emissao_epoch)
+    intervalo = min(INTERVALO_MAXIMO, max(INTERVALO_MINIMO, int(idade * FRACAO_IDADE)))
+    return min(agora + intervalo, prazo)
+
+
+def _sql_prazo(coluna_chave: str = "chave") -> str:
+    casos = " ".join(f"WHEN '{modelo}' THEN {segundos}" for modelo, segundos in PRAZO_EVENTOS.items())
+    return f"CASE substr({coluna_chave}, 21, 2) {casos} ELSE {PRAZO_PADRAO} END"
+
+
+def criar_tabela(conn: sqlite3.Connection, agora: Optional[int] = None):
+    """
+    Cria status_agenda (migração). Notas que já passaram do prazo de eventos
+    entram como finais: foram consultadas pela sincronização completa antiga.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS status_agenda (
+        chave TEXT PRIMARY KEY,
+        last_checked INTEGER,
+        next_check INTEGER,
+        final INTEGER NOT NULL DEFAULT 0,
+        verificacoes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_status_agenda_proxima ON status_agenda(final, next_check)")
+    agora = int(agora if agora is not None else time.time())
+    conn.execute(f"""
+        INSERT OR IGNORE INTO status_agenda (chave, final)
+        SELECT chave, 1 FROM notas_detalhadas
+        WHERE length(chave) = 44 AND data_emissao_epoch IS NOT NULL
+          AND data_emissao_epoch + {_sql_prazo()} <= ?
+    """, (agora,))
+
+
+def chaves_devidas(conn: sqlite3.Connection, limite: Optional[int] = 1000,
+                   agora: Optional[int] = None, modelos: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Chaves cuja verificação venceu (nunca consultadas primeiro, depois pela
+    mais atrasada; empate → mais recente). Ignora eventos, canceladas,
+    denegadas e chaves finais.
+    """
+    agora = int(agora if agora is not None else time.time())
+    filtro_modelo = ""
+    params: list = [agora]
+    if modelos:
+        filtro_modelo = f" AND substr(n.chave, 21, 2) IN ({','.join('?' * len(modelos))})"
+        params.extend(modelos)
+    params.append(-1 if limite is None else int(limite))
+    return [r[0] for r in conn.execute(f"""
+        SELECT n.chave FROM notas_detalhadas n
+        LEFT JOIN status_agenda a ON a.chave = n.chave
+        WHERE length(n.chave) = 44
+          AND COALESCE(n.xml_status, '') <> 'EVENTO'
+          AND lower(COALESCE(n.status, '')) NOT LIKE '%cancel%'
+          AND lower(COALESCE(n.status, '')) NOT LIKE '%deneg%'
+          AND NOT EXISTS (SELECT 1 FROM chaves_canceladas c WHERE c.chave = n.chave)
+          AND COALESCE(a.final, 0) = 0
+          AND COALESCE(a.next_check, 0) <= ?{filtro_modelo}
+        ORDER BY a.next_check IS NOT NULL, a.next_check, n.data_emissao_epoch DESC
+        LIMIT ?
+    """, params)]
+
+
+def registrar_verificacoes(conn: sqlite3.Connection, resultados: Iterable[Tuple[str, Optional[str]]],
+                           agora: Optional[int] = None) -> int:
+    """
+    Grava o resultado de cada consulta: (chave, resultado) com resultado de
+    atualizar_status_notas_lote (None, 'correcao', 'cancelada' ou 'erro').
+    """
+    agora = int(agora if agora is not None else time.time())
+    resultados = list(resultados)
+    if not resultados:
+        return 0
+    emissoes = {}
+    chaves = [c for c, _ in resultados]
+    for i in range(0, len(chaves), 500):
+        parte = chaves[i:i + 500]
+        emissoes.update(conn.execute(
+            f"SELECT chave, data_emissao_epoch FROM notas_detalhadas WHERE chave IN ({','.join('?' * len(parte))})",
+            parte
+        ).fetchall())
+
+    linhas = []
+    for chave, resultado in resultados:
+        if resultado == 'erro':
+            conn.execute(
+                "INSERT INTO status_agenda (chave, next_check) VALUES (?, ?) "
+                "ON CONFLICT(chave) DO UPDATE SET next_check = excluded.next_check",
+                (chave, agora + ESPERA_APOS_ERRO)
+            )
+            continue
+        proxima = None if resultado in RESULTADOS_FINAIS else proxima_verificacao(chave, emissoes.get(chave), agora)
+        linhas.append((chave, agora, proxima, 1 if proxima is None else 0))
+    conn.executemany(
+        "INSERT INTO status_agenda (chave, last_checked, next_check, final, verificacoes) "
+        "VALUES (?, ?, ?, ?, 1) "
+        "ON CONFLICT(chave) DO UPDATE SET last_checked = excluded.last_checked, "
+        "next_check = excluded.next_check, final = excluded.final, "
+        "verificacoes = status_agenda.verificacoes + 1",
+        linhas
+    )
+    return len(resultados)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Arquivamento mensal de XMLs (armazenamento frio).
+
+A árvore xmls/{CNPJ}/{ANO-MES}/{TIPO}/ acumula centenas de milhares de arquivos
+pequenos (5–30 KB). Meses fechados podem ser empacotados em UM arquivo ZIP por
+CNPJ-mês:
+
+    xmls/{CNPJ}/{ANO-MES}/NFe/{chave}.xml   →   xmls/{CNPJ}/{ANO-MES}.zip  (membro "NFe/{chave}.xml")
+
+O ZIP tem diretório central, então a leitura de um único XML é acesso aleatório
+(sem descompactar o mês inteiro). O índice de localização no banco
+(xmls_baixados.caminho_arquivo, xmls_caminhos.caminho, *_docs.caminho_xml)
+passa a apontar para dentro do container usando o formato:
+
+    C:\\...\\xmls\\{CNPJ}\\2025-01.zip::NFe/{chave}.xml
+
+Apenas arquivos .xml são empacotados; PDFs continuam soltos na pasta do mês.
+
+Uso:
+    from modules.arquivo_mensal import caminho_existe, ler_xml
+
+    if caminho_existe(caminho):          # funciona para arquivo solto ou arquivado
+        xml_txt = ler_xml(caminho)
+
+CLI: scripts/arquivar_meses.py (arquivar meses fechados / desarquivar um mês)
+"""
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import zipfile
+from collections import OrderedDict
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+SEPARADOR = "::"
+
+# Colunas que guardam caminho de XML: (tabela, coluna)
+COLUNAS_CAMINHO = (
+    ("xmls_baixados", "caminho_arquivo"),
+    ("xmls_caminhos", "caminho"),
+    ("nfe_docs", "caminho_xml"),
+    ("cte_docs", "caminho_xml"),
+    ("nfse_docs", "caminho_xml"),
+    ("nfce_docs", "caminho_xml"),
+    ("eventos", "caminho"),
+)
+
+_RE_MES = re.compile(r"^(\d{4})-(\d{2})$")
+_RE_MES_LEGADO = re.compile(r"^(\d{2})-(\d{4})$")
+
+# Cache de ZipFile abertos (leitura aleatória sem reabrir o diretório central)
+_MAX_ZIPS_ABERTOS = 8
+_zips_abertos: "OrderedDict[Tuple[str, float], zipfile.ZipFile]" = OrderedDict()
+_zips_lock = threading.Lock()
+
+
+def is_caminho_arquivado(caminho) -> bool:
+    """True se o caminho aponta para dentro de um container mensal."""
+    return bool(caminho) and SEPARADOR in str(caminho)
+
+
+def montar_caminho(zip_path: Union[str, Path], membro: str) -> str:
+    return f"{zip_path}{SEPARADOR}{membro}"
+
+
+def separar_caminho(caminho: str) -> Tuple[str, str]:
+    """'...2025-01.zip::NFe/x.xml' → ('...2025-01.zip', 'NFe/x.xml')"""
+    zip_path, _, membro = str(caminho).rpartition(SEPARADOR)
+    return zip_path, membro
+
+
+def _abrir_zip(zip_path: str) -> Optional[zipfile.ZipFile]:
+    """
+    ZipFile do cache (abre se preciso). Chamar com _zips_lock e usar o
+    objeto antes de soltá-lo: outra thread pode fechá-lo ao tirar do cache.
+    """
+    try:
+        mtime = os.path.getmtime(zip_path)
+    except OSError:
+        return None
+    chave = (zip_path, mtime)
+    zf = _zips_abertos.get(chave)
+    if zf is not None:
+        _zips_abertos.move_to_end(chave)
+        return zf
+    # Versões antigas do mesmo ZIP (reescrito) saem do cache
+    for antiga in [k for k in _zips_abertos if k[0] == zip_path]:
+        _zips_abertos.pop(antiga).close()
+    try:
+        zf = zipfile.ZipFile(zip_path, "r")
+    except (OSError, zipfile.BadZipFile):
+        return None
+    _zips_abertos[chave] = zf
+    while len(_zips_abertos) > _MAX_ZIPS_ABERTOS:
+        _zips_abertos.popitem(last=False)[1].close()
+    return zf
+
+
+def _ler_membro(caminho, so_conferir: bool = False) -> Optional[bytes]:
+    """Bytes do membro arquivado (b"" com so_conferir); None se o ZIP ou o membro não existe."""
+    zip_path, membro = separar_caminho(caminho)
+    with _zips_lock:
+        zf = _abrir_zip(zip_path)
+        if zf is None:
+            return None
+        try:
+            if so_conferir:
+                zf.getinfo(membro)
+                return b""
+            return zf.read(membro)
+        except KeyError:
+            return None
+
+
+def _fechar_zip(zip_path: str):
+    with _zips_lock:
+        for chave in [k for k in _zips_abertos if k[0] == zip_path]:
+            _zips_abertos.pop(chave).close()
+
+
+def caminho_existe(caminho) -> bool:
+    """Equivalente a Path(caminho).exists() que também entende caminhos arquivados."""
+    if not caminho:
+        return False
+    if not is_caminho_arquivado(caminho):
+        return os.path.exists(str(caminho))
+    return _ler_membro(caminho, so_conferir=True) is not None
+
+
+def ler_xml(caminho) -> Optional[str]:
+    """Lê o XML de um arquivo solto ou de dentro do container mensal."""
+    if not caminho:
+        return None
+    if not is_caminho_arquivado(caminho):
+        try:
+            return Path(str(caminho)).read_text(encoding="utf-8", errors="ignore")
+        except OSError:
+            return None
+    dados = _ler_membro(caminho)
+    return None if dados is None else dados.decode("utf-8", errors="ignore")
+
+
+def ler_bytes(caminho) -> Optional[bytes]:
+    """Conteúdo bruto (XML ou PDF) de um arquivo solto ou membro arquivado; None se não existe."""
+    if not caminho:
+        return None
+    if not is_caminho_arquivado(caminho):
+        try:
+            with open(str(caminho), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+    return _ler_membro(caminho)
+
+
+def caminho_solto(caminho) -> Path:
+    """
+    Caminho do arquivo solto equivalente (onde o XML estava antes do
+    arquivamento). Útil para localizar o PDF, que continua na pasta do mês.
+    """
+    if not is_caminho_arquivado(caminho):
+        return Path(str(caminho))
+    zip_path, membro = separar_caminho(caminho)
+    return Path(zip_path).with_suffix("").joinpath(*membro.split("/"))
+
+
+def extrair_temporario(caminho) -> Optional[Path]:
+    """
+    Para código que precisa de um arquivo real (cópia/exportação, abrir no
+    Explorer): extrai o membro arquivado para a pasta temporária e devolve o
+    caminho. Caminhos soltos são devolvidos sem cópia.
+    """
+    if not is_caminho_arquivado(caminho):
+        return Path(str(caminho))
+    conteudo = ler_xml(caminho)
+    if conteudo is None:
+        return None
+    import tempfile
+    destino = Path(tempfile.gettempdir()) / "busca_xml_arquivados" / caminho_solto(caminho).name
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    destino.write_text(conteudo, encoding="utf-8")
+    return destino
+
+
+# ---------------------------------------------------------------------------
+# Seleção de meses
+# ---------------------------------------------------------------------------
+
+def _mes_da_pasta(nome: str) -> Optional[Tuple[int, int]]:
+    m = _RE_MES.match(nome)
+    if m:
+        return int(m.group(1)), int(m.group(2))
+    m = _RE_MES_LEGADO.match(nome)
+    if m:
+        return int(m.group(2)), int(m.group(1))
+    return None
+
+
+def listar_meses_fechados(pasta_xmls: Union[str, Path], meses_abertos: int = 2,
+                          hoje: Optional[date] = None) -> List[Path]:
+    """
+    Lista as pastas {CNPJ}/{ANO-MES} elegíveis para arquivamento.
+
+    Os `meses_abertos` meses mais recentes (contando o corrente) ficam soltos,
+    pois ainda recebem eventos, manifestações e downloads de XML completo.
+    Padrão 2: mantém o mês corrente e o anterior.
+    """
+    hoje = hoje or date.today()
+    limite = hoje.year * 12 + (hoje.month - 1) - meses_abertos
+    pasta_xmls = Path(pasta_xmls)
+    if not pasta_xmls.exists():
+        return []
+    fechados = []
+    for pasta_cnpj in sorted(p for p in pasta_xmls.iterdir() if p.is_dir()):
+        for pasta_mes in sorted(p for p in pasta_cnpj.iterdir() if p.is_dir()):
+            ano_mes = _mes_da_pasta(pasta_mes.name)
+            if ano_mes and ano_mes[0] * 12 + (ano_mes[1] - 1) <= limite:
+                fechados.append(pasta_mes)
+    return fechados
+
+
+# ---------------------------------------------------------------------------
+# Atualização do índice de localização
+# ---------------------------------------------------------------------------
+
+def _atualizar_indice(conn: sqlite3.Connection, trocas: List[Tuple[str, str]]):
+    """Aplica (caminho_novo, caminho_antigo) em todas as colunas de caminho existentes."""
+    tabelas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    for tabela, coluna in COLUNAS_CAMINHO:
+        if tabela not in tabelas:
+            continue
+        conn.executemany(f"UPDATE OR IGNORE {tabela} SET {coluna} = ? WHERE {coluna} = ?", trocas)
+
+
+def arquivar_mes(pasta_mes: Union[str, Path], db_path: Union[str, Path],
+                 remover_soltos: bool = True) -> Dict[str, int]:
+    """
+    Empacota todos os .xml de uma pasta {CNPJ}/{ANO-MES} em {CNPJ}/{ANO-MES}.zip,
+    reaponta o índice do banco para dentro do container e remove os soltos.
+
+    Se o ZIP já existir (XMLs que chegaram atrasados), os novos arquivos são
+    acrescentados; arquivo solto com nome já arquivado (ex.: resumo que
+    depois veio completo) substitui o membro antigo. O container é gravado
+    em arquivo temporário e trocado de forma atômica — uma falha no meio não
+    corrompe o ZIP existente.
+    """
+    pasta_mes = Path(pasta_mes)
+    zip_path = pasta_mes.with_name(f"{pasta_mes.name}.zip")
+    arquivos = sorted(p for p in pasta_mes.rglob("*.xml") if p.is_file())
+    resultado = {"arquivos": 0, "bytes_soltos": 0, "bytes_zip": 0}
+    if not arquivos:
+        return resultado
+
+    tmp_path = zip_path.with_name(zip_path.name + ".tmp")
+    _fechar_zip(str(zip_path))
+    soltos = {arq.relative_to(pasta_mes).as_posix(): arq for arq in arquivos}
+    if zip_path.exists():
+        with zipfile.ZipFile(zip_path, "r") as antigo:
+            substituidos = set(antigo.namelist()) & set(soltos)
+            if substituidos:
+                # ZipFile não troca membro no lugar: reconstrói sem os que serão regravados
+                with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as novo:
+                    for info in antigo.infolist():
+                        if info.filename not in substituidos:
+                            novo.writestr(info, antigo.read(info))
+        if not substituidos:
+            shutil.copy2(zip_path, tmp_path)
+    with zipfile.ZipFile(tmp_path, "a", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+        for membro, arq in soltos.items():
+            zf.write(arq, membro)
+            resultado["bytes_soltos"] += arq.stat().st_size
+    os.replace(tmp_path, zip_path)
+    resultado["bytes_zip"] = zip_path.stat().st_size
+
+    trocas = [(montar_caminho(zip_path, arq.relative_to(pasta_mes).as_posix()), str(arq))
+              for arq in arquivos]
+    with sqlite3.connect(str(db_path), timeout=30) as conn:
+        _atualizar_indice(conn, trocas)
+        conn.commit()
+
+    if remover_soltos:
+        for arq in arquivos:
+            try:
+                arq.unlink()
+            except OSError:
+                pass
+        # Remove subpastas que ficaram vazias (PDFs e outros arquivos permanecem)
+        for pasta in sorted((p for p in pasta_mes.rglob("*") if p.is_dir()), reverse=True) + [pasta_mes]:
+            try:
+                pasta.rmdir()
+            except OSError:
+                pass
+    resultado["arquivos"] = len(arquivos)
+    return resultado
+
+
+def desarquivar_mes(zip_path: Union[str, Path], db_path: Union[str, Path]) -> Dict[str, int]:
+    """
+    Operação inversa: extrai {CNPJ}/{ANO-MES}.zip de volta para arquivos soltos
+    em {CNPJ}/{ANO-MES}/, reaponta o índice do banco e remove o ZIP.
+    """
+    zip_path = Path(zip_path)
+    pasta_mes = zip_path.with_suffix("")
+    _fechar_zip(str(zip_path))
+    trocas = []
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            destino = pasta_mes.joinpath(*info.filename.split("/"))
+            if pasta_mes.resolve() not in destino.resolve().parents:
+                continue  # nunca extrai fora da pasta do mês
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            if not destino.exists():
+                with zf.open(info) as origem, open(destino, "wb") as saida:
+                    shutil.copyfileobj(origem, saida)
+            trocas.append((str(destino), montar_caminho(zip_path, info.filename)))
+
+    with sqlite3.connect(str(db_path), timeout=30) as conn:
+        _atualizar_indice(conn, trocas)
+        conn.commit()
+    zip_path.unlink()
+    return {"arquivos": len(trocas)}
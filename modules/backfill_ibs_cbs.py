@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Preenchimento (backfill) de IBS/CBS das NF-e gravadas antes da Reforma.
+
+_atualizar_ibs_cbs_notas fazia tudo na thread da interface, nota a nota:
+SELECT do caminho, rglob em xmls/ quando não achava, parse do XML inteiro,
+UPDATE + commit — com 100 mil notas o programa ficava congelado por horas.
+Aqui o trabalho roda em segundo plano (Gerenciador de Trabalhos) sobre
+modules/trabalho_paginado — páginas por rowid com checkpoint em config
+(CHAVE_CHECKPOINT), localização em lote e pool de processos:
+
+    - cada processo lê o arquivo e faz iterparse até o fim de <IBSCBSTot>
+      — itens são descartados à medida que terminam e o resto do documento
+      (transporte, pagamento, assinatura, protocolo) nem é lido;
+    - as notas com valor são gravadas com executemany, uma transação por
+      página (os gatilhos de colunas_normalizadas atualizam os centavos).
+
+Uso:
+    job = BackfillIBSCBS(db_path, pasta_xmls=BASE_DIR / 'xmls')
+    stats = job.executar(progresso=lambda feitos, total, stats: ...)
+"""
+from __future__ import annotations
+
+import io
+import sqlite3
+from typing import Dict, List, Tuple
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET  # type: ignore
+
+from modules.trabalho_paginado import TrabalhoPaginado, ler_checkpoint as _ler_checkpoint
+
+CHAVE_CHECKPOINT = 'backfill_ibs_cbs_rowid'
+
+_SQL_PENDENTES = '''
+    SELECT rowid, chave FROM notas_detalhadas
+    WHERE rowid > ?
+      AND tipo = 'NFe'
+      AND COALESCE(v_ibs_centavos, 0) = 0
+      AND COALESCE(v_cbs_centavos, 0) = 0
+    ORDER BY rowid
+'''
+
+
+def _local(tag) -> str:
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def _texto_filho(grupo, nome_grupo: str, nome_valor: str) -> str:
+    for filho in grupo:
+        if _local(filho.tag) == nome_grupo:
+            for neto in filho:
+                if _local(neto.tag) == nome_valor:
+                    return (neto.text or '').strip()
+    return ''
+
+
+def extrair_ibs_cbs(dados: bytes) -> Tuple[str, str]:
+    """
+    (vIBS, vCBS) totais da NF-e, na mesma precedência de
+    nfe_search._extrair_ibs_cbs_nfe: IBSCBSTot/gIBS|gCBS, depois ICMSTot e,
+    por último, o primeiro vIBS/vCBS do documento. Para no fim de IBSCBSTot.
+    """
+    v_ibs = v_cbs = ''
+    tot_ibs = tot_cbs = ''
+    primeiro_ibs = primeiro_cbs = ''
+    for _, el in ET.iterparse(io.BytesIO(dados), events=('end',)):
+        tag = _local(el.tag)
+        if tag == 'vIBS':
+            primeiro_ibs = primeiro_ibs or (el.text or '').strip()
+        elif tag == 'vCBS':
+            primeiro_cbs = primeiro_cbs or (el.text or '').strip()
+        elif tag == 'ICMSTot':
+            for filho in el:
+                if _local(filho.tag) == 'vIBS':
+                    tot_ibs = (filho.text or '').strip()
+                elif _local(filho.tag) == 'vCBS':
+                    tot_cbs = (filho.text or '').strip()
+        elif tag == 'IBSCBSTot':
+            v_ibs = _texto_filho(el, 'gIBS', 'vIBS')
+            v_cbs = _texto_filho(el, 'gCBS', 'vCBS')
+            break
+        elif tag == 'det':
+            el.clear()  # itens já vistos não ficam na memória
+    return v_ibs or tot_ibs or primeiro_ibs, v_cbs or tot_cbs or primeiro_cbs
+
+
+def _valores(dados: bytes, chave: str) -> Tuple[str, str]:
+    """Extrator do pool: (vIBS, vCBS) da nota."""
+    return extrair_ibs_cbs(dados)
+
+
+def ler_checkpoint(conn: sqlite3.Connection) -> int:
+    return _ler_checkpoint(conn, CHAVE_CHECKPOINT)
+
+
+def contar_pendentes(conn: sqlite3.Connection, desde_rowid: int = 0) -> int:
+    return BackfillIBSCBS.contar_pendentes(conn, desde_rowid)
+
+
+class BackfillIBSCBS(TrabalhoPaginado):
+    """Trabalho de preenchimento de IBS/CBS; pausar/retomar/cancelar podem vir de outra thread."""
+
+    ROTULO = '💰 [IBS-CBS]'
+    SQL_PENDENTES = _SQL_PENDENTES
+    CHAVE_CHECKPOINT = CHAVE_CHECKPOINT
+    extrair = staticmethod(_valores)
+
+    def estatisticas(self) -> Dict:
+        return {'atualizadas': 0, 'sem_valores': 0}
+
+    def gravar(self, conn: sqlite3.Connection, resultados: List[Tuple[str, Tuple[str, str]]], stats: Dict):
+        atualizacoes = [(v_ibs or '0', v_cbs or '0', chave) for chave, (v_ibs, v_cbs) in resultados if v_ibs or v_cbs]
+        conn.executemany("UPDATE notas_detalhadas SET v_ibs = ?, v_cbs = ? WHERE chave = ?", atualizacoes)
+        stats['atualizadas'] += len(atualizacoes)
+        stats['sem_valores'] += len(resultados) - len(atualizacoes)
+
+    def resumo(self, stats: Dict) -> str:
+        return f"✅ {stats['atualizadas']} atualizada(s) | ℹ️ {stats['sem_valores']} sem valores"
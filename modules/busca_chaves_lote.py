@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Busca por chave em lote ("Buscar por chave" com listas de centenas/milhares
+de chaves).
+
+_executar_busca_por_chaves percorria a lista chave a chave, na thread da
+interface, tentando os certificados em sequência. Aqui:
+
+    1. A lista é normalizada (44 dígitos, sem repetição) e as chaves já
+       baixadas (xml_status='COMPLETO') saem antes de qualquer requisição.
+    2. Cada chave recebe uma rota de certificados: quem já recebeu a nota
+       pelo NSU (resumo no banco), o emitente (CNPJ na chave), os da UF da
+       chave e depois os demais.
+    3. Cada certificado tem sua fila e seus trabalhadores (max_por_certificado,
+       com intervalo mínimo entre chamadas — a SEFAZ conta consumo por CNPJ);
+       os certificados trabalham em paralelo. Resposta "não é deste
+       certificado" passa a chave para o próximo da rota; erro 656 tira o
+       certificado do resto do lote.
+    4. Os resultados saem à medida que chegam; as chaves sem documento
+       formam a lista de retentativa.
+
+A consulta de UMA chave em UM certificado é do chamador:
+`buscar(chave, indice_certificado) -> ResultadoChave`.
+
+Uso:
+    motor = BuscaChavesLote(certificados, buscar)
+    for resultado in motor.executar(chaves, donos=donos):
+        ...
+    motor.lista_retentativa()
+"""
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+logger = logging.getLogger('nfe_search')
+
+# Situações de ResultadoChave
+OK = 'ok'                              # documento completo obtido
+RESUMO = 'resumo'                      # autorizado, XML indisponível — salvo como resumo
+OUTRO_CERTIFICADO = 'outro_certificado'  # este certificado não tem acesso — próximo da rota
+BLOQUEADO = 'bloqueado'                # 656 — certificado fora pelo resto do lote
+FALHA = 'falha'                        # SEFAZ respondeu sem documento (não autorizada, indisponível)
+ERRO = 'erro'                          # exceção/rede
+NAO_ENCONTRADA = 'nao_encontrada'      # nenhum certificado da rota tem acesso
+CANCELADA = 'cancelada'
+JA_BAIXADA = 'ja_baixada'
+
+ENCONTRADAS = (OK, RESUMO, JA_BAIXADA)
+RETENTAVEIS = (BLOQUEADO, ERRO, CANCELADA)
+
+MAX_POR_CERTIFICADO = 1
+INTERVALO_MINIMO = 1.0   # segundos entre chamadas do mesmo certificado
+LOTE_SQL = 500
+
+
+@dataclass
+class ResultadoChave:
+    chave: str
+    situacao: str
+    xml: Optional[str] = None
+    certificado: Optional[int] = None   # índice em `certificados`
+    mensagem: str = ''
+    dados: Dict = field(default_factory=dict)
+
+    @property
+    def encontrada(self) -> bool:
+        return self.situacao in ENCONTRADAS
+
+
+def _digitos(valor) -> str:
+    return ''.join(c for c in str(valor or '') if c.isdigit())
+
+
+def normalizar_chaves(chaves: Iterable[str]) -> List[str]:
+    """Chaves de 44 dígitos, sem repetição, na ordem recebida."""
+    vistas = set()
+    saida = []
+    for chave in chaves:
+        chave = _digitos(chave)
+        if len(chave) == 44 and chave not in vistas:
+            vistas.add(chave)
+            saida.append(chave)
+    return saida
+
+
+def _em_lotes(chaves: Sequence[str]):
+    for i in range(0, len(chaves), LOTE_SQL):
+        yield chaves[i:i + LOTE_SQL]
+
+
+def ja_baixadas(conn, chaves: Sequence[str]) -> Set[str]:
+    """Chaves que já têm o XML completo no banco."""
+    encontradas = set()
+    for lote in _em_lotes(list(chaves)):
+        marcas = ','.join('?' * len(lote))
+        encontradas.update(r[0] for r in conn.execute(
+            f"SELECT chave FROM notas_detalhadas WHERE xml_status = 'COMPLETO' AND chave IN ({marcas})", lote))
+    return encontradas
+
+
+def donos_conhecidos(conn, chaves: Sequence[str]) -> Dict[str, str]:
+    """chave → informante que já recebeu a nota (resumo/evento pelo NSU)."""
+    donos = {}
+    for lote in _em_lotes(list(chaves)):
+        marcas = ','.join('?' * len(lote))
+        for chave, informante in conn.execute(
+                f"SELECT chave, informante FROM notas_detalhadas "
+                f"WHERE chave IN ({marcas}) AND informante IS NOT NULL AND informante != ''", lote):
+            donos[chave] = informante
+    return donos
+
+
+def rotear(chave: str, certificados: Sequence[Sequence], dono: Optional[str] = None) -> List[int]:
+    """
+    Ordem de tentativa dos certificados (tuplas cnpj, caminho, senha,
+    informante, cUF): dono conhecido, emitente da chave, mesma UF, demais.
+    """
+    emitente = chave[6:20]
+    dono = _digitos(dono)
+    prioridades = []
+    for i, cert in enumerate(certificados):
+        cnpj, inf, cuf = _digitos(cert[0]), _digitos(cert[3]), str(cert[4] or '')
+        if dono and dono in (cnpj, inf):
+            prioridade = 0
+        elif emitente in (cnpj, inf):
+            prioridade = 1
+        elif cuf == chave[:2]:
+            prioridade = 2
+        else:
+            prioridade = 3
+        prioridades.append((prioridade, i))
+    return [i for _, i in sorted(prioridades)]
+
+
+class BuscaChavesLote:
+    """
+    Distribui as chaves pelas filas dos certificados e devolve os
+    resultados à medida que ficam prontos.
+
+    Args:
+        certificados: tuplas (cnpj, caminho, senha, informante, cUF).
+        buscar: consulta UMA chave com UM certificado (índice).
+        bloqueados: índices já em cooldown 656 antes de começar.
+    """
+
+    def __init__(self, certificados: Sequence[Sequence],
+                 buscar: Callable[[str, int], ResultadoChave],
+                 max_por_certificado: int = MAX_POR_CERTIFICADO,
+                 intervalo_minimo: float = INTERVALO_MINIMO,
+                 bloqueados: Iterable[int] = (),
+                 relogio: Callable[[], float] = time.monotonic,
+                 dormir: Callable[[float], None] = time.sleep):
+        self.certificados = list(certificados)
+        self.buscar = buscar
+        self.max_por_certificado = max(1, max_por_certificado)
+        self.intervalo_minimo = intervalo_minimo
+        self.bloqueados: Set[int] = set(bloqueados)
+        self._relogio = relogio
+        self._dormir = dormir
+        self._cancelado = threading.Event()
+        self._lock = threading.Lock()
+        self._vez: Dict[int, threading.Lock] = {}
+        self._ultima_chamada: Dict[int, float] = {}
+        self.resultados: Dict[str, ResultadoChave] = {}
+        self.requisicoes = 0
+
+    def cancelar(self):
+        """As chaves que ainda não começaram saem como CANCELADA."""
+        self._cancelado.set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self._cancelado.is_set()
+
+    def lista_retentativa(self, situacoes: Optional[Iterable[str]] = None) -> List[str]:
+        """Chaves sem documento (todas as não encontradas, ou só as `situacoes` pedidas)."""
+        with self._lock:
+            if situacoes is None:
+                return [c for c, r in self.resultados.items() if not r.encontrada]
+            situacoes = set(situacoes)
+            return [c for c, r in self.resultados.items() if r.situacao in situacoes]
+
+    def _aguardar_vez(self, indice: int):
+        with self._lock:
+            vez = self._vez.setdefault(indice, threading.Lock())
+        with vez:
+            ultima = self._ultima_chamada.get(indice)
+            if ultima is not None:
+                espera = ultima + self.intervalo_minimo - self._relogio()
+                if espera > 0:
+                    self._dormir(espera)
+            self._ultima_chamada[indice] = self._relogio()
+
+    def executar(self, chaves: Iterable[str], donos: Optional[Dict[str, str]] = None,
+                 ja_baixadas: Iterable[str] = ()) -> Iterator[ResultadoChave]:
+        chaves = normalizar_chaves(chaves)
+        donos = donos or {}
+        baixadas = set(ja_baixadas)
+        for chave in chaves:
+            if chave in baixadas:
+                yield self._registrar(ResultadoChave(chave, JA_BAIXADA, mensagem="XML completo já está no banco"))
+        chaves = [c for c in chaves if c not in baixadas]
+        if not chaves:
+            return
+        if not self.certificados:
+            for chave in chaves:
+                yield self._registrar(ResultadoChave(chave, ERRO, mensagem="Nenhum certificado cadastrado"))
+            return
+
+        rotas = {c: rotear(c, self.certificados, donos.get(c)) for c in chaves}
+        posicao = {c: 0 for c in chaves}
+        motivos: Dict[str, List[ResultadoChave]] = {c: [] for c in chaves}
+        filas = {i: queue.Queue() for i in range(len(self.certificados))}
+        saida: "queue.Queue[ResultadoChave]" = queue.Queue()
+
+        def encaminhar(chave: str):
+            """Próximo certificado da rota ou resultado final."""
+            with self._lock:
+                posicao[chave] += 1
+                pos = posicao[chave]
+            rota = rotas[chave]
+            if pos < len(rota):
+                filas[rota[pos]].put(chave)
+                return
+            tentativas = motivos[chave]
+            situacoes = {r.situacao for r in tentativas}
+            if BLOQUEADO in situacoes:
+                bloqueio = next(r for r in tentativas if r.situacao == BLOQUEADO)
+                final = ResultadoChave(chave, BLOQUEADO, certificado=bloqueio.certificado,
+                                       mensagem="Rate limit SEFAZ (656) — aguarde ~1 hora e tente novamente")
+            elif ERRO in situacoes:
+                erro = next(r for r in reversed(tentativas) if r.situacao == ERRO)
+                final = ResultadoChave(chave, ERRO, certificado=erro.certificado, mensagem=erro.mensagem)
+            else:
+                final = ResultadoChave(chave, NAO_ENCONTRADA, mensagem="Não encontrada em nenhum certificado")
+            saida.put(final)
+
+        def trabalhador(indice: int):
+            while True:
+                chave = filas[indice].get()
+                if chave is None:
+                    return
+                if self.cancelado:
+                    saida.put(ResultadoChave(chave, CANCELADA, mensagem="Busca cancelada"))
+                    continue
+                if indice in self.bloqueados:
+                    motivos[chave].append(ResultadoChave(chave, BLOQUEADO, certificado=indice))
+                    encaminhar(chave)
+                    continue
+                self._aguardar_vez(indice)
+                with self._lock:
+                    self.requisicoes += 1
+                try:
+                    resultado = self.buscar(chave, indice)
+                except Exception as e:
+                    resultado = ResultadoChave(chave, ERRO, mensagem=str(e))
+                resultado.certificado = indice
+                if resultado.situacao == BLOQUEADO:
+                    if indice not in self.bloqueados:
+                        self.bloqueados.add(indice)
+                        logger.warning(f"🔒 [BUSCA-CHAVE] Certificado {self.certificados[indice][0]} "
+                                       f"bloqueado (656) — fora do resto do lote")
+                if resultado.situacao in (BLOQUEADO, OUTRO_CERTIFICADO, ERRO):
+                    motivos[chave].append(resultado)
+                    encaminhar(chave)
+                else:
+                    saida.put(resultado)
+
+        for chave in chaves:
+            filas[rotas[chave][0]].put(chave)
+        usados = {rota_i for rota in rotas.values() for rota_i in rota}
+        threads = []
+        for indice in sorted(usados):
+            for n in range(self.max_por_certificado):
+                t = threading.Thread(target=trabalhador, args=(indice,), daemon=True,
+                                     name=f"busca-chave-{indice}-{n}")
+                t.start()
+                threads.append((indice, t))
+        logger.info(f"🚀 [BUSCA-CHAVE] {len(chaves)} chave(s) em {len(usados)} certificado(s)")
+
+        entregues = 0
+        try:
+            while entregues < len(chaves):
+                resultado = saida.get()
+                entregues += 1
+                yield self._registrar(resultado)
+        finally:
+            # Fim normal ou consumidor parou antes: encerra os trabalhadores
+            if entregues < len(chaves):
+                self.cancelar()
+            for indice, _ in threads:
+                filas[indice].put(None)
+
+    def _registrar(self, resultado: ResultadoChave) -> ResultadoChave:
+        with self._lock:
+            self.resultados[resultado.chave] = resultado
+        return resultado
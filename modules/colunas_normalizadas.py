@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Colunas normalizadas ("sombra") de notas_detalhadas.
+
+Os campos monetários (valor, base_icms, valor_icms, v_ibs, v_cbs) e a
+data_emissao são TEXT em formatos misturados ("1234.56", "1.234,56",
+"R$ 1.234,56", "2026-01-05T10:00:00-03:00", "05/01/2026"). Para que soma,
+filtro por período e ordenação rodem em SQL (e usem índice), cada um ganha
+uma coluna tipada:
+
+    valor        → valor_centavos       INTEGER
+    base_icms    → base_icms_centavos   INTEGER
+    valor_icms   → valor_icms_centavos  INTEGER
+    v_ibs        → v_ibs_centavos       INTEGER
+    v_cbs        → v_cbs_centavos       INTEGER
+    data_emissao → data_emissao_iso     TEXT ('AAAA-MM-DD')
+                   data_emissao_epoch   INTEGER (segundos Unix)
+
+As colunas são mantidas por GATILHOS no próprio banco (AFTER INSERT e AFTER
+UPDATE OF nas colunas de origem), então qualquer gravação — nfe_search,
+interface, scripts — já sai normalizada. A mesma expressão SQL é usada no
+backfill da migração (modules/schema_migrations).
+
+Valor de origem NULL → coluna NULL (desconhecido); texto vazio ou inválido → 0.
+"""
+from __future__ import annotations
+
+import sqlite3
+from typing import Optional
+
+# coluna de origem → coluna em centavos
+COLUNAS_MONETARIAS = (
+    ("valor", "valor_centavos"),
+    ("base_icms", "base_icms_centavos"),
+    ("valor_icms", "valor_icms_centavos"),
+    ("v_ibs", "v_ibs_centavos"),
+    ("v_cbs", "v_cbs_centavos"),
+)
+
+COLUNAS_ORIGEM = tuple(origem for origem, _ in COLUNAS_MONETARIAS) + ("data_emissao",)
+
+
+def sql_centavos(coluna: str) -> str:
+    """Expressão SQL que converte a coluna (formato BR ou US) para centavos inteiros."""
+    t = f"trim(replace({coluna}, 'R$', ''))"
+    return (
+        f"CASE WHEN {coluna} IS NULL THEN NULL ELSE CAST(ROUND(CAST(CASE"
+        # 1.234,56 / 1234,56 → decimal com vírgula (BR)
+        f" WHEN instr({t}, ',') > 0 AND (instr({t}, '.') > 0"
+        f"   OR substr({t}, -2, 1) = ',' OR substr({t}, -3, 1) = ',')"
+        f"   THEN replace(replace({t}, '.', ''), ',', '.')"
+        # 1,234 → vírgula como separador de milhar
+        f" WHEN instr({t}, ',') > 0 THEN replace({t}, ',', '')"
+        # 1234.56 / 1234.5 → decimal com ponto (US)
+        f" WHEN substr({t}, -2, 1) = '.' OR substr({t}, -3, 1) = '.' THEN {t}"
+        # 1.234 / 1.234.567 → ponto como separador de milhar (BR)
+        f" ELSE replace({t}, '.', '')"
+        f" END AS REAL) * 100) AS INTEGER) END"
+    )
+
+
+def sql_data_iso(coluna: str) -> str:
+    """Expressão SQL: data de emissão → 'AAAA-MM-DD' (data local do documento)."""
+    t = f"trim({coluna})"
+    return (
+        f"CASE"
+        f" WHEN substr({t}, 3, 1) = '/' AND substr({t}, 6, 1) = '/'"
+        f"   THEN substr({t}, 7, 4) || '-' || substr({t}, 4, 2) || '-' || substr({t}, 1, 2)"
+        f" WHEN substr({t}, 5, 1) = '-' AND substr({t}, 8, 1) = '-' THEN substr({t}, 1, 10)"
+        f" END"
+    )
+
+
+def sql_data_epoch(coluna: str) -> str:
+    """Expressão SQL: data de emissão → epoch (respeita o fuso de dhEmi quando houver)."""
+    return f"CAST(strftime('%s', COALESCE(datetime(trim({coluna})), {sql_data_iso(coluna)})) AS INTEGER)"
+
+
+def _atribuicoes(prefixo: str = "") -> str:
+    partes = [f"{destino} = {sql_centavos(prefixo + origem)}" for origem, destino in COLUNAS_MONETARIAS]
+    partes.append(f"data_emissao_iso = {sql_data_iso(prefixo + 'data_emissao')}")
+    partes.append(f"data_emissao_epoch = {sql_data_epoch(prefixo + 'data_emissao')}")
+    return ",\n            ".join(partes)
+
+
+def criar_colunas_e_gatilhos(conn: sqlite3.Connection):
+    """Cria colunas, gatilhos e índices; preenche as linhas existentes (migração)."""
+    existentes = {row[1] for row in conn.execute("PRAGMA table_info(notas_detalhadas)")}
+    novas = [(destino, "INTEGER") for _, destino in COLUNAS_MONETARIAS]
+    novas += [("data_emissao_iso", "TEXT"), ("data_emissao_epoch", "INTEGER")]
+    for nome, tipo in novas:
+        if nome not in existentes:
+            conn.execute(f"ALTER TABLE notas_detalhadas ADD COLUMN {nome} {tipo}")
+
+    conn.execute("DROP TRIGGER IF EXISTS trg_notas_normaliza_ins")
+    conn.execute("DROP TRIGGER IF EXISTS trg_notas_normaliza_upd")
+    conn.execute(f"""
+        CREATE TRIGGER trg_notas_normaliza_ins AFTER INSERT ON notas_detalhadas
+        BEGIN
+            UPDATE notas_detalhadas SET
+            {_atribuicoes('NEW.')}
+            WHERE rowid = NEW.rowid;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER trg_notas_normaliza_upd
+        AFTER UPDATE OF {', '.join(COLUNAS_ORIGEM)} ON notas_detalhadas
+        BEGIN
+            UPDATE notas_detalhadas SET
+            {_atribuicoes('NEW.')}
+            WHERE rowid = NEW.rowid;
+        END
+    """)
+
+    # Backfill das linhas existentes
+    conn.execute(f"UPDATE notas_detalhadas SET\n            {_atribuicoes()}")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_data_iso ON notas_detalhadas(data_emissao_iso)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_informante_data ON notas_detalhadas(informante, data_emissao_iso)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_valor_centavos ON notas_detalhadas(valor_centavos)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_ibs_cbs ON notas_detalhadas(v_ibs_centavos, v_cbs_centavos)")
+
+
+# ---------------------------------------------------------------------------
+# Formatação (interface)
+# ---------------------------------------------------------------------------
+
+def formatar_centavos(centavos: Optional[int]) -> str:
+    """12345678 → 'R$ 123.456,78' (None → '')."""
+    if centavos is None:
+        return ""
+    reais = centavos / 100
+    return f"R$ {reais:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def iso_para_br(data_iso: Optional[str]) -> str:
+    """'2026-01-05' → '05/01/2026' (None → '')."""
+    if not data_iso or len(data_iso) < 10:
+        return ""
+    return f"{data_iso[8:10]}/{data_iso[5:7]}/{data_iso[0:4]}"
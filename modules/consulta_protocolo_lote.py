@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Consulta de situação (protocolo) em lote — NF-e/NFC-e (NFeConsultaProtocolo4)
+e CT-e (CTeConsultaV4).
+
+fetch_prot_nfe / fetch_prot_cte / cte_consultar_por_chave consultam UMA chave
+por chamada, cada uma montando serviço e sessão mTLS novos. Aqui as chaves
+são agrupadas por (cUF, modelo), cada grupo vai para o endpoint da sua UF e
+todas as requisições reaproveitam uma sessão quente por certificado
+(PoolSessoes). O número de requisições simultâneas é limitado POR ENDPOINT —
+várias UFs caem no mesmo SVRS e contam juntas — e os resultados são
+devolvidos à medida que chegam.
+
+Respostas obtidas há menos de `ttl` segundos (CacheProtocolos) não são
+consultadas de novo: abrir a mesma nota duas vezes ou repetir uma busca
+logo em seguida não gasta requisição.
+
+Uso:
+    from modules.consulta_protocolo_lote import ConsultaProtocoloLote
+
+    lote = ConsultaProtocoloLote(consultar, resolver_url, escopo=cnpj)
+    for resultado in lote.executar(chaves):
+        ...  # resultado.chave, resultado.xml, resultado.erro, resultado.do_cache
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger('nfe_search')
+
+TTL_PADRAO = 300          # segundos em que uma resposta é reaproveitada
+MAX_POR_ENDPOINT = 4      # requisições simultâneas no mesmo webservice
+MAX_TOTAL = 16            # requisições simultâneas no lote inteiro
+MODELOS_SUPORTADOS = ('55', '65', '57')
+
+
+@dataclass
+class ResultadoProtocolo:
+    chave: str
+    xml: Optional[str]
+    erro: Optional[str] = None
+    do_cache: bool = False
+
+
+def modelo_da_chave(chave: str) -> str:
+    return chave[20:22] if len(chave) == 44 else ''
+
+
+def agrupar_por_uf_modelo(chaves: Iterable[str]) -> Dict[Tuple[str, str], List[str]]:
+    """Agrupa chaves válidas (sem repetição, na ordem recebida) por (cUF, modelo)."""
+    grupos: Dict[Tuple[str, str], List[str]] = OrderedDict()
+    vistas = set()
+    for chave in chaves:
+        chave = (chave or '').strip()
+        if len(chave) != 44 or not chave.isdigit() or chave in vistas:
+            continue
+        modelo = modelo_da_chave(chave)
+        if modelo not in MODELOS_SUPORTADOS:
+            continue
+        vistas.add(chave)
+        grupos.setdefault((chave[:2], modelo), []).append(chave)
+    return grupos
+
+
+class CacheProtocolos:
+    """Respostas recentes por (escopo, chave), válidas por `ttl` segundos."""
+
+    def __init__(self, ttl: float = TTL_PADRAO, max_itens: int = 20000):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._itens: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, escopo: str, chave: str, ttl: Optional[float] = None,
+              agora: Optional[float] = None) -> Optional[str]:
+        agora = time.monotonic() if agora is None else agora
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            item = self._itens.get((escopo, chave))
+            if item is None:
+                return None
+            instante, xml = item
+            if agora - instante > ttl:
+                del self._itens[(escopo, chave)]
+                return None
+            return xml
+
+    def guardar(self, escopo: str, chave: str, xml: str, agora: Optional[float] = None):
+        agora = time.monotonic() if agora is None else agora
+        with self._lock:
+            self._itens[(escopo, chave)] = (agora, xml)
+            self._itens.move_to_end((escopo, chave))
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def esquecer(self, chave: Optional[str] = None):
+        with self._lock:
+            if chave is None:
+                self._itens.clear()
+            else:
+                for k in [k for k in self._itens if k[1] == chave]:
+                    del self._itens[k]
+
+
+class PoolSessoes:
+    """Uma sessão HTTP quente (mTLS) por certificado, criada sob demanda."""
+
+    def __init__(self):
+        self._sessoes: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def obter(self, chave_pool: str, criar: Callable[[], object]):
+        with self._lock:
+            sessao = self._sessoes.get(chave_pool)
+        if sessao is None:
+            sessao = criar()
+            with self._lock:
+                sessao = self._sessoes.setdefault(chave_pool, sessao)
+        return sessao
+
+    def descartar(self, chave_pool: str):
+        with self._lock:
+            sessao = self._sessoes.pop(chave_pool, None)
+        if sessao is not None and hasattr(sessao, 'close'):
+            try:
+                sessao.close()
+            except Exception:
+                pass
+
+
+_cache = CacheProtocolos()
+_pool = PoolSessoes()
+
+
+def cache_compartilhado() -> CacheProtocolos:
+    return _cache
+
+
+def pool_compartilhado() -> PoolSessoes:
+    return _pool
+
+
+def _intercalar(grupos: Dict[Tuple[str, str], List[str]]) -> Iterator[Tuple[str, str, str]]:
+    """(cuf, modelo, chave) alternando entre grupos — uma UF grande não segura as outras."""
+    filas = [(cuf, modelo, list(chaves)) for (cuf, modelo), chaves in grupos.items()]
+    while filas:
+        restantes = []
+        for cuf, modelo, chaves in filas:
+            yield cuf, modelo, chaves.pop(0)
+            if chaves:
+                restantes.append((cuf, modelo, chaves))
+        filas = restantes
+
+
+class ConsultaProtocoloLote:
+    """
+    Executa `consultar(url, chave, modelo) -> xml | None` para muitas chaves.
+
+    Args:
+        consultar: faz UMA consulta (levanta exceção em erro de rede).
+        resolver_url: (cuf, modelo) -> URL do webservice.
+        escopo: separa o cache (ex.: CNPJ do certificado).
+    """
+
+    def __init__(self, consultar: Callable[[str, str, str], Optional[str]],
+                 resolver_url: Callable[[str, str], str],
+                 max_por_endpoint: int = MAX_POR_ENDPOINT, max_total: int = MAX_TOTAL,
+                 cache: Optional[CacheProtocolos] = None, ttl: Optional[float] = None,
+                 escopo: str = ''):
+        self.consultar = consultar
+        self.resolver_url = resolver_url
+        self.max_por_endpoint = max(1, max_por_endpoint)
+        self.max_total = max(1, max_total)
+        self.cache = cache if cache is not None else cache_compartilhado()
+        self.ttl = ttl
+        self.escopo = escopo
+        self._semaforos: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+        self.requisicoes = 0
+
+    def _semaforo(self, url: str) -> threading.Semaphore:
+        with self._lock:
+            if url not in self._semaforos:
+                self._semaforos[url] = threading.Semaphore(self.max_por_endpoint)
+            return self._semaforos[url]
+
+    def _uma(self, url: str, chave: str, modelo: str) -> ResultadoProtocolo:
+        with self._semaforo(url):
+            with self._lock:
+                self.requisicoes += 1
+            try:
+                xml = self.consultar(url, chave, modelo)
+            except Exception as e:
+                return ResultadoProtocolo(chave, None, erro=str(e))
+        if xml:
+            self.cache.guardar(self.escopo, chave, xml)
+        return ResultadoProtocolo(chave, xml)
+
+    def executar(self, chaves: Iterable[str]) -> Iterator[ResultadoProtocolo]:
+        """Resultados na ordem em que chegam (respostas em cache primeiro)."""
+        grupos = agrupar_por_uf_modelo(chaves)
+        pendentes = OrderedDict()
+        for (cuf, modelo), lista in grupos.items():
+            faltam = []
+            for chave in lista:
+                xml = self.cache.obter(self.escopo, chave, ttl=self.ttl)
+                if xml is not None:
+                    yield ResultadoProtocolo(chave, xml, do_cache=True)
+                else:
+                    faltam.append(chave)
+            if faltam:
+                pendentes[(cuf, modelo)] = faltam
+        if not pendentes:
+            return
+
+        total = sum(len(v) for v in pendentes.values())
+        logger.info(f"🚀 [Protocolo-Lote] {total} chave(s) em {len(pendentes)} grupo(s) UF/modelo")
+        pool = ThreadPoolExecutor(max_workers=min(self.max_total, total), thread_name_prefix="protocolo")
+        try:
+            futures = [pool.submit(self._uma, self.resolver_url(cuf, modelo), chave, modelo)
+                       for cuf, modelo, chave in _intercalar(pendentes)]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Consumidor parou antes do fim: descarta o que ainda não começou
+            pool.shutdown(wait=False, cancel_futures=True)
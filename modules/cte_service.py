@@ -120,8 +120,10 @@ class CTeService:
             pkcs12_filename=cert_path, pkcs12_password=senha
         ))
         
-        # Configuração de transporte com timeout maior (60s) para CT-e
-        trans = Transport(session=sess, timeout=60, operation_timeout=60)
+        # Configuração de transporte com timeout maior (60s) para CT-e; WSDL/XSDs
+        # vêm do cache em disco quando já conhecidos (modules/wsdl_cache)
+        from modules.wsdl_cache import cache_documentos, revalidar_em_segundo_plano
+        trans = Transport(session=sess, timeout=60, operation_timeout=60, cache=cache_documentos())
 
         # Monta lista de URLs a tentar (filtra entradas None)
         urls_tentativas = [(nome, url) for nome, url in [
@@ -139,6 +141,7 @@ class CTeService:
                 self.dist_client = Client(wsdl=url_dist, transport=trans)
                 url_usada = url_dist
                 logger.info(f"✅ Cliente CTe inicializado via {nome_url}: {url_dist}")
+                revalidar_em_segundo_plano(sess)
                 break  # Conectou com sucesso
             except Exception as e:
                 logger.warning(f"⚠️ Falha ao conectar CT-e via {nome_url}: {str(e)[:100]}")
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Pré-download em segundo plano do DANFSe oficial (PDF do Ambiente Nacional).
+
+Sem isto o PDF oficial só é baixado quando o usuário dá duplo clique na NFS-e
+(uma chamada GET /danfse/{chave} com retry, enquanto a interface espera).
+O prefetcher recebe as chaves recém-ingeridas, baixa os PDFs com
+concorrência limitada reaproveitando UMA sessão mTLS por certificado, grava o
+arquivo ao lado do XML (NFSe_{numero}.pdf) e registra pdf_path/pdf_tipo
+'OFICIAL' — a abertura pela interface vira só abrir um arquivo local.
+
+Limite de taxa: usa o mesmo ControleAIMD da busca de NSU
+(modules.nfse_busca_concorrente.controle_compartilhado) — um 429 pausa os
+dois e reduz a janela de ambos.
+
+Uso:
+    from modules.danfse_prefetch import obter_prefetcher
+
+    prefetcher = obter_prefetcher(db)
+    prefetcher.enfileirar_pendentes(cert_data)   # NFS-e do informante sem PDF oficial
+"""
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from modules.arquivo_mensal import caminho_solto
+from modules.nfse_busca_concorrente import ControleAIMD, controle_compartilhado, interpretar_retry_after
+
+logger = logging.getLogger('nfe_search')
+
+MAX_SIMULTANEOS = 3
+TAMANHO_MINIMO_PDF = 1024   # mesmo critério de nfse_service.DANFSE_TAMANHO_MINIMO
+TAMANHO_CHAVE_ADN = 50      # só chaves do Padrão Nacional têm DANFSe no ADN
+
+CertData = Tuple[str, str, str, str, str]  # (cnpj, caminho, senha, informante, cuf)
+
+
+@dataclass
+class TarefaDANFSe:
+    chave: str
+    caminho_xml: str
+    cert_data: CertData
+    numero: Optional[str] = None
+
+
+def _criar_servico_adn(cert_data: CertData):
+    from modules.nfse_service import NFSeService
+    cnpj, caminho, senha, informante, cuf = cert_data
+    return NFSeService(caminho, senha, cnpj, cuf, ambiente='producao')
+
+
+def destino_pdf(caminho_xml: str) -> Path:
+    """PDF fica ao lado do XML (para XML arquivado em ZIP, na pasta do mês)."""
+    return caminho_solto(caminho_xml).with_suffix('.pdf')
+
+
+class PrefetcherDANFSe:
+    """Fila + threads de download do DANFSe oficial."""
+
+    def __init__(self, db, max_simultaneos: int = MAX_SIMULTANEOS,
+                 controle: Optional[ControleAIMD] = None,
+                 criar_servico: Callable[[CertData], object] = _criar_servico_adn):
+        self.db = db
+        self.max_simultaneos = max(1, max_simultaneos)
+        self.controle = controle or controle_compartilhado()
+        self._criar_servico = criar_servico
+        self._fila: "queue.Queue[TarefaDANFSe]" = queue.Queue()
+        self._cond = threading.Condition()
+        self._pendentes = set()       # chaves na fila ou em download
+        self._indisponiveis = set()   # 404 no ADN (município não integrado, nota legada)
+        self._servicos: Dict[str, object] = {}
+        self._ativos = 0
+        self._threads = []
+        self.baixados = 0
+
+    # ------------------------------------------------------------------
+    # Entrada
+    # ------------------------------------------------------------------
+
+    def enfileirar(self, chave: str, caminho_xml: str, cert_data: CertData,
+                   numero: Optional[str] = None) -> bool:
+        if not chave or len(chave) != TAMANHO_CHAVE_ADN or not caminho_xml:
+            return False
+        with self._cond:
+            if chave in self._pendentes or chave in self._indisponiveis:
+                return False
+            self._pendentes.add(chave)
+            self._iniciar_threads()
+        self._fila.put(TarefaDANFSe(chave, str(caminho_xml), cert_data, numero))
+        return True
+
+    def enfileirar_pendentes(self, cert_data: CertData, limite: int = 500) -> int:
+        """Enfileira as NFS-e do informante que ainda não têm PDF oficial (mais recentes primeiro)."""
+        informante = cert_data[3]
+        with self.db._connect() as conn:
+            rows = conn.execute(
+                """SELECT n.chave, n.numero, n.pdf_path, x.caminho_arquivo
+                   FROM notas_detalhadas n
+                   LEFT JOIN xmls_baixados x ON x.chave = n.chave
+                   WHERE n.informante = ? AND n.tipo IN ('NFS-e', 'NFSE', 'NFS-E')
+                     AND COALESCE(n.pdf_tipo, '') <> 'OFICIAL' AND length(n.chave) = ?
+                   ORDER BY n.data_emissao_iso DESC
+                   LIMIT ?""",
+                (informante, TAMANHO_CHAVE_ADN, limite)
+            ).fetchall()
+        total = 0
+        for chave, numero, pdf_path, caminho_arquivo in rows:
+            # Em NFS-e recém-salva o pdf_path aponta para o próprio XML
+            caminho_xml = caminho_arquivo or (pdf_path if str(pdf_path or '').lower().endswith('.xml') else None)
+            if caminho_xml and self.enfileirar(chave, caminho_xml, cert_data, numero):
+                total += 1
+        if total:
+            logger.info(f"📥 [DANFSe] {total} PDF(s) oficial(is) na fila de pré-download ({informante})")
+        return total
+
+    def aguardar(self, timeout: Optional[float] = None) -> bool:
+        """Espera a fila esvaziar (True) ou o timeout acabar (False)."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pendentes:
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante if restante is not None else 0.5)
+        return True
+
+    # ------------------------------------------------------------------
+    # Trabalho
+    # ------------------------------------------------------------------
+
+    def _iniciar_threads(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.max_simultaneos:
+            t = threading.Thread(target=self._trabalhar, name=f"danfse-prefetch-{len(self._threads)}",
+                                 daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _servico(self, cert_data: CertData):
+        cnpj = cert_data[0]
+        with self._cond:
+            servico = self._servicos.get(cnpj)
+        if servico is None:
+            servico = self._criar_servico(cert_data)
+            with self._cond:
+                servico = self._servicos.setdefault(cnpj, servico)
+        return servico
+
+    def _trabalhar(self):
+        while True:
+            tarefa = self._fila.get()
+            # Respeita a pausa de 429 e a janela AIMD compartilhada
+            with self._cond:
+                while True:
+                    espera = self.controle.espera_restante(time.monotonic())
+                    if espera == 0 and self._ativos < min(self.max_simultaneos, self.controle.limite):
+                        break
+                    self._cond.wait(min(espera, 1.0) or 0.2)
+                self._ativos += 1
+            repetir = False
+            try:
+                repetir = self._baixar(tarefa)
+            except Exception as e:
+                logger.warning(f"⚠️ [DANFSe] Falha no pré-download de {tarefa.chave[:20]}…: {e}")
+            finally:
+                with self._cond:
+                    self._ativos -= 1
+                    if not repetir:
+                        self._pendentes.discard(tarefa.chave)
+                    self._cond.notify_all()
+                if repetir:
+                    self._fila.put(tarefa)
+                self._fila.task_done()
+
+    def _ja_oficial(self, chave: str, destino: Path) -> bool:
+        """
+        True se o banco já registra o DANFSe oficial neste arquivo. Só o
+        tamanho não basta: o DANFSe genérico (pdf_simple) usa o mesmo caminho.
+        """
+        with self.db._connect() as conn:
+            row = conn.execute("SELECT pdf_path, pdf_tipo FROM notas_detalhadas WHERE chave = ?",
+                               (chave,)).fetchone()
+        if not row or row[1] != 'OFICIAL' or not row[0]:
+            return False
+        try:
+            return (Path(row[0]).resolve() == destino.resolve()
+                    and destino.stat().st_size >= TAMANHO_MINIMO_PDF)
+        except OSError:
+            return False
+
+    def _baixar(self, tarefa: TarefaDANFSe) -> bool:
+        """Baixa e registra um DANFSe. Retorna True se a tarefa deve voltar à fila (429)."""
+        destino = destino_pdf(tarefa.caminho_xml)
+        if self._ja_oficial(tarefa.chave, destino):
+            return False
+        try:
+            pdf_bytes = self._servico(tarefa.cert_data).consultar_danfse(
+                tarefa.chave, retry=1, numero=tarefa.numero, cnpj_prestador=tarefa.cert_data[0])
+        except Exception as e:
+            resposta = getattr(e, 'response', None)
+            status = getattr(resposta, 'status_code', None)
+            if status == 429:
+                retry_after = interpretar_retry_after(resposta.headers.get('Retry-After'))
+                self.controle.limitado(retry_after, time.monotonic())
+                return True
+            if status == 404:
+                self._indisponiveis.add(tarefa.chave)
+                return False
+            raise
+        self.controle.sucesso()
+        # Substitui de forma atômica o PDF que estiver lá (ex.: DANFSe genérico)
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        tmp = destino.with_name(destino.name + '.tmp')
+        tmp.write_bytes(pdf_bytes)
+        os.replace(tmp, destino)
+        self.baixados += 1
+        self.db.atualizar_pdf_path(tarefa.chave, str(destino.resolve()), 'OFICIAL')
+        logger.debug(f"📄 [DANFSe] PDF oficial pronto: {destino}")
+        return False
+
+
+_prefetcher: Optional[PrefetcherDANFSe] = None
+_prefetcher_lock = threading.Lock()
+
+
+def obter_prefetcher(db) -> PrefetcherDANFSe:
+    """Instância única no processo (as threads e as sessões sobrevivem entre ciclos)."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = PrefetcherDANFSe(db)
+        return _prefetcher
@@ -5,6 +5,10 @@ from pathlib import Path
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+from .agenda_status import chaves_devidas, registrar_verificacoes
+from .fila_offline import contar as contar_fila, enfileirar
+from .schema_migrations import aplicar_migracoes
+
 # Importa módulo de criptografia PORTÁVEL (para distribuição em .exe)
 try:
     from .crypto_portable import get_portable_crypto as get_crypto
@@ -35,563 +39,8 @@ class DatabaseManager:
         return sqlite3.connect(str(self.db_path))
     
     def _initialize(self):
-        """Initialize database tables."""
-        with self._connect() as conn:
-            conn.execute('''CREATE TABLE IF NOT EXISTS certificados (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                cnpj_cpf TEXT,
-                caminho TEXT,
-                senha TEXT,
-                informante TEXT,
-                cUF_autor TEXT,
-                ativo INTEGER DEFAULT 1
-            )''')
-            
-            # Adiciona coluna ativo se não existir (migração)
-            try:
-                conn.execute("ALTER TABLE certificados ADD COLUMN ativo INTEGER DEFAULT 1")
-                conn.commit()
-            except Exception:
-                # Coluna já existe, ignora
-                pass
-            
-            # Adiciona coluna criado_em se não existir (migração)
-            try:
-                conn.execute("ALTER TABLE certificados ADD COLUMN criado_em TEXT")
-                conn.commit()
-            except Exception:
-                # Coluna já existe, ignora
-                pass
-            
-            # Adiciona coluna razao_social se não existir (migração)
-            try:
-                conn.execute("ALTER TABLE certificados ADD COLUMN razao_social TEXT")
-                conn.commit()
-            except Exception:
-                # Coluna já existe, ignora
-                pass
-            
-            # Adiciona coluna nome_certificado se não existir (migração)
-            try:
-                conn.execute("ALTER TABLE certificados ADD COLUMN nome_certificado TEXT")
-                conn.commit()
-            except Exception:
-                # Coluna já existe, ignora
-                pass
-            
-            conn.execute('''CREATE TABLE IF NOT EXISTS xmls_baixados (
-                chave TEXT PRIMARY KEY,
-                cnpj_cpf TEXT,
-                caminho_arquivo TEXT,
-                xml_completo TEXT,
-                baixado_em TEXT
-            )''')
-            # Migração: adicionar coluna xml_completo se não existir
-            try:
-                conn.execute("ALTER TABLE xmls_baixados ADD COLUMN xml_completo TEXT")
-            except:
-                pass  # Coluna já existe
-            conn.execute('''CREATE TABLE IF NOT EXISTS nf_status (
-                chNFe TEXT PRIMARY KEY,
-                cStat TEXT,
-                xMotivo TEXT
-            )''')
-            conn.execute('''CREATE TABLE IF NOT EXISTS nsu (
-                informante TEXT PRIMARY KEY,
-                ult_nsu TEXT
-            )''')
-            conn.execute('''CREATE TABLE IF NOT EXISTS nsu_cte (
-                informante TEXT PRIMARY KEY,
-                ult_nsu TEXT
-            )''')
-            conn.execute('''CREATE TABLE IF NOT EXISTS nsu_nfse (
-                informante TEXT PRIMARY KEY,
-                ult_nsu TEXT
-            )''')
-            conn.execute('''CREATE TABLE IF NOT EXISTS erro_656 (
-                informante TEXT PRIMARY KEY,
-                ultimo_erro TIMESTAMP,
-                nsu_bloqueado TEXT
-            )''')
-            conn.execute('''CREATE TABLE IF NOT EXISTS config (
-                chave TEXT PRIMARY KEY,
-                valor TEXT
-            )''')
-            conn.execute('''CREATE TABLE IF NOT EXISTS notas_detalhadas (
-                chave TEXT PRIMARY KEY,
-                ie_tomador TEXT,
-                nome_emitente TEXT,
-                cnpj_emitente TEXT,
-                nome_destinatario TEXT,
-                cnpj_destinatario TEXT,
-                numero TEXT,
-                data_emissao TEXT,
-                tipo TEXT,
-                valor TEXT,
-                cfop TEXT,
-                vencimento TEXT,
-                ncm TEXT,
-                status TEXT,
-                natureza TEXT,
-                uf TEXT,
-                base_icms TEXT,
-                valor_icms TEXT,
-                informante TEXT,
-                xml_status TEXT,
-                atualizado_em TEXT
-            )''')
-            
-            # Tabela de manifestações registradas
-            conn.execute('''CREATE TABLE IF NOT EXISTS manifestacoes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chave TEXT NOT NULL,
-                tipo_evento TEXT NOT NULL,
-                informante TEXT NOT NULL,
-                data_manifestacao TEXT NOT NULL,
-                status TEXT,
-                protocolo TEXT,
-                UNIQUE(chave, tipo_evento, informante)
-            )''')            
-            
-            # Tabela de chaves canceladas (para não buscar mais eventos)
-            conn.execute('''CREATE TABLE IF NOT EXISTS chaves_canceladas (
-                chave TEXT PRIMARY KEY,
-                data_cancelamento TEXT NOT NULL,
-                motivo TEXT
-            )''')
-            
-            # Tabela de estado de sincronização (para retomar após interrupção)
-            conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                ultima_chave TEXT,
-                total_docs INTEGER,
-                docs_processados INTEGER,
-                data_inicio TEXT,
-                status TEXT
-            )''')
-            
-            # Índice para busca rápida
-            try:
-                conn.execute('''CREATE INDEX IF NOT EXISTS idx_manifestacoes_chave 
-                             ON manifestacoes(chave)''')
-                conn.execute('''CREATE INDEX IF NOT EXISTS idx_manifestacoes_informante 
-                             ON manifestacoes(informante)''')
-            except Exception:
-                pass
-            
-            # Migração: Adiciona colunas destinatário se não existirem
-            try:
-                cursor = conn.execute("PRAGMA table_info(notas_detalhadas)")
-                columns = [row[1] for row in cursor.fetchall()]
-                if 'nome_destinatario' not in columns:
-                    print("[MIGRAÇÃO] Adicionando coluna nome_destinatario...")
-                    conn.execute("ALTER TABLE notas_detalhadas ADD COLUMN nome_destinatario TEXT")
-                    print("[MIGRAÇÃO] Coluna nome_destinatario adicionada com sucesso")
-                if 'cnpj_destinatario' not in columns:
-                    print("[MIGRAÇÃO] Adicionando coluna cnpj_destinatario...")
-                    conn.execute("ALTER TABLE notas_detalhadas ADD COLUMN cnpj_destinatario TEXT")
-                    print("[MIGRAÇÃO] Coluna cnpj_destinatario adicionada com sucesso")
-                
-                # Migração: Adiciona coluna pdf_path para cache de caminho do PDF
-                if 'pdf_path' not in columns:
-                    print("[MIGRAÇÃO] Adicionando coluna pdf_path para cache de PDFs...")
-                    conn.execute("ALTER TABLE notas_detalhadas ADD COLUMN pdf_path TEXT")
-                    print("[MIGRAÇÃO] ✅ Coluna pdf_path adicionada com sucesso")
-                    print("[INFO] PDFs serão indexados automaticamente conforme forem acessados")
-                
-                # Migração: Adiciona coluna pdf_tipo ('OFICIAL', 'GENERICO', NULL=desconhecido)
-                if 'pdf_tipo' not in columns:
-                    print("[MIGRAÇÃO] Adicionando coluna pdf_tipo para controle de qualidade de PDFs...")
-                    conn.execute("ALTER TABLE notas_detalhadas ADD COLUMN pdf_tipo TEXT")
-                    print("[MIGRAÇÃO] ✅ Coluna pdf_tipo adicionada com sucesso")
-                
-                # Migração: Adiciona colunas IBS e CBS (Reforma Tributária)
-                if 'v_ibs' not in columns:
-                    print("[MIGRAÇÃO] Adicionando coluna v_ibs (Imposto sobre Bens e Serviços)...")
-                    conn.execute("ALTER TABLE notas_detalhadas ADD COLUMN v_ibs TEXT")
-                    print("[MIGRAÇÃO] ✅ Coluna v_ibs adicionada com sucesso")
-                if 'v_cbs' not in columns:
-                    print("[MIGRAÇÃO] Adicionando coluna v_cbs (Contribuição sobre Bens e Serviços)...")
-                    conn.execute("ALTER TABLE notas_detalhadas ADD COLUMN v_cbs TEXT")
-                    print("[MIGRAÇÃO] ✅ Coluna v_cbs adicionada com sucesso")
-
-                # Reparo: preenche nome_destinatario em NFS-e ADN que foram salvas sem esse campo
-                try:
-                    conn.execute("""
-                        UPDATE notas_detalhadas
-                        SET nome_destinatario = (
-                            SELECT d.tom_xnome FROM nfse_docs d
-                            WHERE d.prest_cnpj = notas_detalhadas.cnpj_emitente
-                              AND d.n_nfse = notas_detalhadas.numero
-                              AND d.tom_xnome IS NOT NULL AND d.tom_xnome != ''
-                            LIMIT 1
-                        )
-                        WHERE tipo = 'NFS-e'
-                          AND (nome_destinatario IS NULL OR nome_destinatario = '')
-                          AND EXISTS (
-                            SELECT 1 FROM nfse_docs d
-                            WHERE d.prest_cnpj = notas_detalhadas.cnpj_emitente
-                              AND d.n_nfse = notas_detalhadas.numero
-                              AND d.tom_xnome IS NOT NULL AND d.tom_xnome != ''
-                          )
-                    """)
-                    if conn.execute("SELECT changes()").fetchone()[0]:
-                        print("[MIGRAÇÃO] ✅ nome_destinatario preenchido para NFS-e ADN existentes")
-                except Exception as _e:
-                    print(f"[MIGRAÇÃO] Aviso ao reparar nome_destinatario: {_e}")
-                    try:
-                        from modules.log_categorias import log_falha
-                        log_falha('database', documento="migração nome_destinatario (NFS-e)", erro=_e, nivel='WARNING')
-                    except Exception:
-                        pass
-            except Exception as e:
-                print(f"[MIGRAÇÃO] Erro ao adicionar colunas: {e}")
-                try:
-                    from modules.log_categorias import log_falha
-                    log_falha('database', documento="migração adicionar colunas", erro=e, nivel='WARNING')
-                except Exception:
-                    pass
-
-            # ------------------------------------------------------------------
-            # Tabela nfe_docs — campos completos extraídos do XML NF-e
-            # ------------------------------------------------------------------
-            conn.execute('''CREATE TABLE IF NOT EXISTS nfe_docs (
-                chave          TEXT PRIMARY KEY,
-                informante     TEXT,
-                caminho_xml    TEXT,
-                caminho_pdf    TEXT,
-                xml_status     TEXT,
-                -- ide
-                c_uf           TEXT,
-                nat_op         TEXT,
-                mod            TEXT,
-                serie          TEXT,
-                n_nf           TEXT,
-                dh_emi         TEXT,
-                dh_sai_ent     TEXT,
-                tp_nf          TEXT,
-                id_dest        TEXT,
-                c_mun_fg       TEXT,
-                tp_imp         TEXT,
-                tp_emis        TEXT,
-                fin_nfe        TEXT,
-                ind_final      TEXT,
-                ind_pres       TEXT,
-                -- emitente
-                emit_cnpj      TEXT,
-                emit_cpf       TEXT,
-                emit_ie        TEXT,
-                emit_xnome     TEXT,
-                emit_xfant     TEXT,
-                emit_xlgr      TEXT,
-                emit_nro       TEXT,
-                emit_xbairro   TEXT,
-                emit_cmun      TEXT,
-                emit_xmun      TEXT,
-                emit_uf        TEXT,
-                emit_cep       TEXT,
-                emit_crt       TEXT,
-                -- destinatário
-                dest_cnpj      TEXT,
-                dest_cpf       TEXT,
-                dest_ie        TEXT,
-                dest_xnome     TEXT,
-                dest_xlgr      TEXT,
-                dest_nro       TEXT,
-                dest_xbairro   TEXT,
-                dest_cmun      TEXT,
-                dest_xmun      TEXT,
-                dest_uf        TEXT,
-                dest_cep       TEXT,
-                -- totais ICMSTot
-                v_bc           TEXT,
-                v_icms         TEXT,
-                v_icms_deson   TEXT,
-                v_fcp          TEXT,
-                v_bc_st        TEXT,
-                v_st           TEXT,
-                v_fcp_st       TEXT,
-                v_prod         TEXT,
-                v_frete        TEXT,
-                v_seg          TEXT,
-                v_desc         TEXT,
-                v_ii           TEXT,
-                v_ipi          TEXT,
-                v_pis          TEXT,
-                v_cofins       TEXT,
-                v_outro        TEXT,
-                v_nf           TEXT,
-                v_tot_trib     TEXT,
-                -- IBS/CBS (Reforma Tributária)
-                v_ibs          TEXT,
-                v_cbs          TEXT,
-                v_bc_ibscbs    TEXT,
-                -- transporte
-                mod_frete      TEXT,
-                transp_cnpj    TEXT,
-                transp_xnome   TEXT,
-                -- pagamento
-                t_pag          TEXT,
-                v_pag          TEXT,
-                -- protocolo
-                n_prot         TEXT,
-                dh_recbto      TEXT,
-                c_stat         TEXT,
-                x_motivo       TEXT,
-                -- controle
-                indexado_em    TEXT
-            )''')
-            try:
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_informante ON nfe_docs(informante)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_emit_cnpj ON nfe_docs(emit_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_dest_cnpj ON nfe_docs(dest_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_dh_emi ON nfe_docs(dh_emi)")
-            except Exception:
-                pass
-
-            # ------------------------------------------------------------------
-            # Tabela cte_docs — campos completos extraídos do XML CT-e
-            # ------------------------------------------------------------------
-            conn.execute('''CREATE TABLE IF NOT EXISTS cte_docs (
-                chave          TEXT PRIMARY KEY,
-                informante     TEXT,
-                caminho_xml    TEXT,
-                caminho_pdf    TEXT,
-                xml_status     TEXT,
-                -- ide
-                c_uf           TEXT,
-                c_ct           TEXT,
-                cfop           TEXT,
-                nat_op         TEXT,
-                mod            TEXT,
-                serie          TEXT,
-                n_ct           TEXT,
-                dh_emi         TEXT,
-                tp_imp         TEXT,
-                tp_emis        TEXT,
-                tp_amb         TEXT,
-                tp_cte         TEXT,
-                modal          TEXT,
-                tp_serv        TEXT,
-                c_mun_ini      TEXT,
-                x_mun_ini      TEXT,
-                uf_ini         TEXT,
-                c_mun_fim      TEXT,
-                x_mun_fim      TEXT,
-                uf_fim         TEXT,
-                -- emitente
-                emit_cnpj      TEXT,
-                emit_ie        TEXT,
-                emit_xnome     TEXT,
-                emit_xfant     TEXT,
-                emit_uf        TEXT,
-                emit_xmun      TEXT,
-                emit_cep       TEXT,
-                -- remetente
-                rem_cnpj       TEXT,
-                rem_cpf        TEXT,
-                rem_ie         TEXT,
-                rem_xnome      TEXT,
-                rem_uf         TEXT,
-                rem_xmun       TEXT,
-                rem_cep        TEXT,
-                -- destinatário
-                dest_cnpj      TEXT,
-                dest_cpf       TEXT,
-                dest_ie        TEXT,
-                dest_xnome     TEXT,
-                dest_uf        TEXT,
-                dest_xmun      TEXT,
-                dest_cep       TEXT,
-                -- tomador
-                tom_cnpj       TEXT,
-                tom_cpf        TEXT,
-                tom_ie         TEXT,
-                tom_xnome      TEXT,
-                -- valores prestação
-                v_tprest       TEXT,
-                v_rec          TEXT,
-                -- impostos
-                v_tot_trib     TEXT,
-                cst_icms       TEXT,
-                v_bc_icms      TEXT,
-                v_icms         TEXT,
-                -- carga
-                v_carga        TEXT,
-                pro_pred       TEXT,
-                v_carga_averb  TEXT,
-                -- NF-e vinculadas (JSON array de chaves)
-                nfe_vinculadas TEXT,
-                -- modal rodoviário
-                rntrc          TEXT,
-                veic_placa     TEXT,
-                -- protocolo
-                n_prot         TEXT,
-                dh_recbto      TEXT,
-                c_stat         TEXT,
-                x_motivo       TEXT,
-                -- controle
-                indexado_em    TEXT
-            )''')
-            try:
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_informante ON cte_docs(informante)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_emit_cnpj ON cte_docs(emit_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_rem_cnpj ON cte_docs(rem_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_dest_cnpj ON cte_docs(dest_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_dh_emi ON cte_docs(dh_emi)")
-            except Exception:
-                pass
-
-            # ------------------------------------------------------------------
-            # Tabela nfse_docs — campos completos extraídos do XML NFS-e
-            # ------------------------------------------------------------------
-            conn.execute('''CREATE TABLE IF NOT EXISTS nfse_docs (
-                chave          TEXT PRIMARY KEY,
-                informante     TEXT,
-                caminho_xml    TEXT,
-                caminho_pdf    TEXT,
-                xml_status     TEXT,
-                -- identificação
-                n_nfse         TEXT,
-                n_dfse         TEXT,
-                n_dps          TEXT,
-                serie          TEXT,
-                dh_proc        TEXT,
-                dh_emi         TEXT,
-                d_compet       TEXT,
-                c_stat         TEXT,
-                x_motivo       TEXT,
-                tp_emis        TEXT,
-                tp_amb         TEXT,
-                ver_aplic      TEXT,
-                -- localização
-                c_loc_incid    TEXT,
-                x_loc_incid    TEXT,
-                x_trib_nac     TEXT,
-                x_trib_mun     TEXT,
-                x_nbs          TEXT,
-                c_loc_prestacao TEXT,
-                -- prestador (emitente)
-                prest_cnpj     TEXT,
-                prest_cpf      TEXT,
-                prest_im       TEXT,
-                prest_xnome    TEXT,
-                prest_xfant    TEXT,
-                prest_cmun     TEXT,
-                prest_uf       TEXT,
-                prest_cep      TEXT,
-                prest_email    TEXT,
-                -- regime tributário
-                op_simp_nac    TEXT,
-                reg_esp_trib   TEXT,
-                -- tomador
-                tom_cnpj       TEXT,
-                tom_cpf        TEXT,
-                tom_xnome      TEXT,
-                tom_cmun       TEXT,
-                tom_uf         TEXT,
-                tom_cep        TEXT,
-                tom_email      TEXT,
-                -- serviço
-                c_trib_nac     TEXT,
-                c_trib_mun     TEXT,
-                x_desc_serv    TEXT,
-                c_nbs          TEXT,
-                -- valores
-                v_serv         TEXT,
-                v_bc           TEXT,
-                p_aliq         TEXT,
-                v_issqn        TEXT,
-                v_total_ret    TEXT,
-                v_liq          TEXT,
-                v_calc_dr      TEXT,
-                -- controle
-                indexado_em    TEXT
-            )''')
-            try:
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_informante ON nfse_docs(informante)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_prest_cnpj ON nfse_docs(prest_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_tom_cnpj ON nfse_docs(tom_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_dh_emi ON nfse_docs(dh_emi)")
-            except Exception:
-                pass
-
-            # Tabela nfce_docs — campos completos extraídos do XML NFC-e (modelo 65)
-            # ------------------------------------------------------------------
-            conn.execute('''CREATE TABLE IF NOT EXISTS nfce_docs (
-                chave          TEXT PRIMARY KEY,
-                informante     TEXT,
-                caminho_xml    TEXT,
-                caminho_pdf    TEXT,
-                xml_status     TEXT,
-                -- identificação
-                c_uf           TEXT,
-                nat_op         TEXT,
-                mod            TEXT,
-                serie          TEXT,
-                n_nf           TEXT,
-                dh_emi         TEXT,
-                tp_nf          TEXT,
-                c_mun_fg       TEXT,
-                tp_emis        TEXT,
-                fin_nfe        TEXT,
-                -- emitente
-                emit_cnpj      TEXT,
-                emit_cpf       TEXT,
-                emit_ie        TEXT,
-                emit_xnome     TEXT,
-                emit_xfant     TEXT,
-                emit_xlgr      TEXT,
-                emit_nro       TEXT,
-                emit_xbairro   TEXT,
-                emit_cmun      TEXT,
-                emit_xmun      TEXT,
-                emit_uf        TEXT,
-                emit_cep       TEXT,
-                emit_crt       TEXT,
-                -- destinatário (opcional na NFC-e)
-                dest_cnpj      TEXT,
-                dest_cpf       TEXT,
-                dest_xnome     TEXT,
-                -- produtos (JSON array)
-                produtos       TEXT,
-                qt_itens       INTEGER,
-                -- totais ICMSTot
-                v_prod         TEXT,
-                v_desc         TEXT,
-                v_frete        TEXT,
-                v_seg          TEXT,
-                v_outro        TEXT,
-                v_pis          TEXT,
-                v_cofins       TEXT,
-                v_nf           TEXT,
-                v_bc           TEXT,
-                v_icms         TEXT,
-                v_icms_deson   TEXT,
-                v_tot_trib     TEXT,
-                -- pagamento
-                t_pag          TEXT,
-                v_pag          TEXT,
-                v_troco        TEXT,
-                -- QR Code / suplementar
-                qr_code        TEXT,
-                url_chave      TEXT,
-                -- protocolo
-                n_prot         TEXT,
-                dh_recbto      TEXT,
-                c_stat         TEXT,
-                x_motivo       TEXT,
-                -- controle
-                indexado_em    TEXT
-            )''')
-            try:
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfce_docs_informante ON nfce_docs(informante)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfce_docs_emit_cnpj ON nfce_docs(emit_cnpj)")
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_nfce_docs_dh_emi ON nfce_docs(dh_emi)")
-            except Exception:
-                pass
-
-            conn.commit()
+        """Aplica as migrações pendentes do esquema (modules/schema_migrations)."""
+        aplicar_migracoes(self.db_path)
     
     def load_notes(self, limit: int = 1000) -> List[Dict[str, Any]]:
         """Load notes from database."""
@@ -603,6 +52,57 @@ class DatabaseManager:
             )
             return [dict(row) for row in cursor.fetchall()]
     
+    def ultima_alteracao_seq(self) -> int:
+        """Último número da sequência de alterações de notas_detalhadas."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT ultimo FROM sequencia_alteracoes WHERE id = 1").fetchone()
+            return int(row[0]) if row else 0
+    
+    def load_alteracoes(self, desde_seq: int) -> tuple:
+        """
+        Delta de notas_detalhadas desde `desde_seq` (exclusivo).
+        
+        Retorna: (alteradas: List[Dict], removidas: List[str], ultimo_seq: int)
+        """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT ultimo FROM sequencia_alteracoes WHERE id = 1").fetchone()
+            ultimo = int(row[0]) if row else 0
+            alteradas = [dict(r) for r in conn.execute(
+                "SELECT * FROM notas_detalhadas WHERE alteracao_seq > ? AND alteracao_seq <= ? "
+                "ORDER BY alteracao_seq", (desde_seq, ultimo)
+            )]
+            removidas = [r[0] for r in conn.execute(
+                "SELECT chave FROM notas_removidas WHERE alteracao_seq > ? AND alteracao_seq <= ?",
+                (desde_seq, ultimo)
+            )]
+            return alteradas, removidas, ultimo
+    
+    def chaves_status_devidas(self, limite: Optional[int] = 1000, modelos=None) -> List[str]:
+        """Próximo lote de chaves cuja verificação de eventos venceu (modules/agenda_status)."""
+        with self._connect() as conn:
+            return chaves_devidas(conn, limite=limite, modelos=modelos)
+    
+    def registrar_verificacoes_status(self, resultados) -> int:
+        """Agenda a próxima verificação de cada (chave, resultado) consultado."""
+        with self._connect() as conn:
+            total = registrar_verificacoes(conn, resultados)
+            conn.commit()
+            return total
+    
+    def enfileirar_requisicao(self, tipo: str, informante: str, chave: str,
+                              payload: Optional[Dict[str, Any]] = None, apos: float = 0) -> bool:
+        """Guarda um pedido à SEFAZ para ser refeito quando houver conexão (modules/fila_offline)."""
+        with self._connect() as conn:
+            novo = enfileirar(conn, tipo, informante, chave, payload, apos=apos)
+            conn.commit()
+            return novo
+    
+    def pedidos_na_fila(self) -> Dict[str, int]:
+        """Quantidade de pedidos aguardando conexão, por tipo."""
+        with self._connect() as conn:
+            return contar_fila(conn)
+    
     def load_certificates(self) -> List[Dict[str, Any]]:
         """Load certificates from database."""
         with self._connect() as conn:
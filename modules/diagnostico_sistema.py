@@ -165,7 +165,8 @@ def checar_caminhos_xml(amostra: int = 50) -> Dict[str, Any]:
     if not rows:
         return _item("Caminhos de XML (amostra recente)", ATENCAO, "Nenhum XML registrado no banco ainda", "storage")
 
-    invalidos = sum(1 for (caminho,) in rows if not Path(caminho).exists())
+    from modules.arquivo_mensal import caminho_existe
+    invalidos = sum(1 for (caminho,) in rows if not caminho_existe(caminho))
     total = len(rows)
     if invalidos == 0:
         return _item("Caminhos de XML (amostra recente)", OK, f"{total}/{total} encontrados em disco", "storage")
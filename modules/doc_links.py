@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de vínculos entre documentos (CT-e ↔ NF-e, NF-e referenciada, eventos).
+
+O CT-e cita as NF-e que transporta (infDoc/infNFe/chave), a NF-e cita as
+notas que devolve/complementa (NFref/refNFe) e os eventos 6101xx–6106xx
+avisam a NF-e de CT-e/MDF-e emitidos para ela. Nada disso era indexado:
+achar o CT-e de uma NF-e abria todos os XMLs de CT-e do informante. A
+tabela doc_links guarda uma linha por (origem, destino, relacao):
+
+    origem   chave do documento que cita (CT-e, NF-e, MDF-e)
+    destino  chave citada
+    relacao  'transporta' | 'referencia' | 'complementa' | 'substitui' | 'anterior'
+    fonte    'documento' (XML do próprio documento) | 'evento' (evento na NF-e)
+
+    - xml_indexer.parse_nfe/parse_cte devolvem os vínculos em dados['vinculos']
+      e a ingestão grava com registrar();
+    - eventos de CT-e/MDF-e para a NF-e são gravados junto com o índice de
+      eventos (desvinculado/cancelado remove o vínculo);
+    - IndexadorVinculos: varredura única dos XMLs já baixados (Gerenciador
+      de Trabalhos); ao terminar marca CHAVE_BACKFILL em config;
+    - consultas: relacionados() (painel "Documentos relacionados"),
+      ctes_da_nfe() e nfes_transportadas() (conciliação de frete por join).
+
+Uso:
+    with sqlite3.connect(db_path) as conn:
+        registrar(conn, extrair_vinculos(xml_bytes))
+        docs = relacionados(conn, chave)
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET  # type: ignore
+
+from modules.arquivo_mensal import ler_bytes
+from modules.payload_codec import descompactar
+from modules.trabalho_paginado import Trabalho, marcado, marcar
+
+logger = logging.getLogger('nfe_search')
+
+CHAVE_BACKFILL = 'doc_links_backfill'
+LOTE_DB = 500
+
+MODELOS = {'55': 'NFe', '65': 'NFCe', '57': 'CTe', '58': 'MDFe'}
+
+# (relacao, sentido) → descrição para o painel; sentido 'saida' = este documento cita o outro
+DESCRICOES = {
+    ('transporta', 'entrada'): "transporta este documento",
+    ('transporta', 'saida'): "transportado por este documento",
+    ('referencia', 'entrada'): "referencia este documento",
+    ('referencia', 'saida'): "referenciado por este documento",
+    ('complementa', 'entrada'): "complementa este documento",
+    ('complementa', 'saida'): "complementado por este documento",
+    ('substitui', 'entrada'): "substitui este documento",
+    ('substitui', 'saida'): "substituído por este documento",
+    ('anterior', 'entrada'): "usa este documento como anterior",
+    ('anterior', 'saida'): "documento anterior",
+}
+
+# Eventos na NF-e que registram CT-e/MDF-e emitidos para ela
+EVENTOS_VINCULO = ('610130', '610500', '610514', '610600', '610610', '610614')
+EVENTOS_DESVINCULO = ('610131', '610510', '610601', '610611', '610615')
+
+# Elementos citados: (elemento-pai, elemento com a chave) → relação
+_CITACOES = {
+    ('refNFe', None): 'referencia',            # NF-e: ide/NFref/refNFe
+    ('refCTe', None): 'referencia',            # NF-e: ide/NFref/refCTe
+    ('infNFe', 'chave'): 'transporta',         # CT-e: infDoc/infNFe/chave
+    ('infCteComp', 'chCTe'): 'complementa',    # CT-e complementar
+    ('infCteComp', 'chave'): 'complementa',    # CT-e 3.00
+    ('infCteSub', 'chCte'): 'substitui',       # CT-e de substituição
+    ('infCteSub', 'chCTe'): 'substitui',
+    ('idDocAntEle', 'chCTe'): 'anterior',      # CT-e: docAnt (subcontratação/redespacho)
+    ('infNFe', 'chNFe'): 'transporta',         # MDF-e: infMunDescarga/infNFe/chNFe
+    ('infCTe', 'chCTe'): 'transporta',         # MDF-e: infMunDescarga/infCTe/chCTe
+}
+_RAIZES_DOC = {'infNFe': 'NFe', 'infCte': 'CTe', 'infMDFe': 'MDFe'}
+
+Vinculo = namedtuple('Vinculo', 'origem destino relacao fonte ativo')
+
+
+def criar_tabela(conn: sqlite3.Connection):
+    """Cria a tabela doc_links (migração)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS doc_links (
+        origem TEXT NOT NULL,
+        destino TEXT NOT NULL,
+        relacao TEXT NOT NULL,
+        fonte TEXT NOT NULL DEFAULT 'documento',
+        registrado_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        PRIMARY KEY (origem, destino, relacao)
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_doc_links_destino ON doc_links(destino, relacao)")
+
+
+def tipo_da_chave(chave: str) -> str:
+    return MODELOS.get(chave[20:22] if len(chave or '') == 44 else '', 'Documento')
+
+
+# ---------------------------------------------------------------------------
+# Extração
+# ---------------------------------------------------------------------------
+
+def _local(tag) -> str:
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def _chave_valida(texto: Optional[str]) -> Optional[str]:
+    texto = (texto or '').strip()
+    return texto if len(texto) == 44 and texto.isdigit() else None
+
+
+def _vinculos_evento(raiz) -> List[Vinculo]:
+    """Evento de CT-e/MDF-e na NF-e: o CT-e/MDF-e citado no detEvento transporta a nota."""
+    vinculos = []
+    for ev in raiz.iter():
+        if _local(ev.tag) != 'infEvento':
+            continue
+        campos = {_local(el.tag): (el.text or '').strip() for el in ev.iter() if el is not ev}
+        tp = campos.get('tpEvento', '')
+        nota = _chave_valida(campos.get('chNFe'))
+        if not nota or tp not in EVENTOS_VINCULO + EVENTOS_DESVINCULO:
+            continue
+        for el in ev.iter():
+            if _local(el.tag) in ('chCTe', 'chMDFe'):
+                transporte = _chave_valida(el.text)
+                if transporte and transporte != nota:
+                    vinculos.append(Vinculo(transporte, nota, 'transporta', 'evento', tp in EVENTOS_VINCULO))
+    return vinculos
+
+
+def vinculos_da_arvore(raiz) -> List[Vinculo]:
+    """Vínculos citados por um XML já parseado (NF-e, CT-e, MDF-e ou evento)."""
+    origem = None
+    for el in raiz.iter():
+        nome = _local(el.tag)
+        if nome in _RAIZES_DOC:
+            origem = _chave_valida((el.get('Id') or '')[len(_RAIZES_DOC[nome]):])
+            break
+    if origem is None:
+        return _vinculos_evento(raiz)
+    vinculos, vistos = [], set()
+    for pai in raiz.iter():
+        nome_pai = _local(pai.tag)
+        if (nome_pai, None) in _CITACOES:
+            candidatos = [(pai, _CITACOES[(nome_pai, None)])]
+        else:
+            candidatos = [(filho, _CITACOES[(nome_pai, _local(filho.tag))]) for filho in pai
+                          if (nome_pai, _local(filho.tag)) in _CITACOES]
+        for el, relacao in candidatos:
+            destino = _chave_valida(el.text)
+            if destino and destino != origem and (destino, relacao) not in vistos:
+                vistos.add((destino, relacao))
+                vinculos.append(Vinculo(origem, destino, relacao, 'documento', True))
+    return vinculos
+
+
+def extrair_vinculos(dados: Union[bytes, str]) -> List[Vinculo]:
+    if isinstance(dados, str):
+        dados = dados.encode('utf-8')
+    return vinculos_da_arvore(ET.fromstring(dados))
+
+
+# ---------------------------------------------------------------------------
+# Gravação
+# ---------------------------------------------------------------------------
+
+def registrar(conn: sqlite3.Connection, vinculos: Iterable[Vinculo], origem: Optional[str] = None) -> int:
+    """
+    Grava os vínculos. Com `origem`, os vínculos 'documento' dessa chave são
+    substituídos pelos novos (reprocessar o XML não deixa vínculos velhos).
+    Vínculos inativos (evento de desvinculação/cancelamento) são removidos.
+    """
+    vinculos = list(vinculos)
+    if origem:
+        conn.execute("DELETE FROM doc_links WHERE origem = ? AND fonte = 'documento'", (origem,))
+    ativos = [(v.origem, v.destino, v.relacao, v.fonte) for v in vinculos if v.ativo]
+    conn.executemany(
+        "INSERT INTO doc_links (origem, destino, relacao, fonte) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(origem, destino, relacao) DO NOTHING", ativos)
+    conn.executemany("DELETE FROM doc_links WHERE origem = ? AND destino = ? AND relacao = ?",
+                     [(v.origem, v.destino, v.relacao) for v in vinculos if not v.ativo])
+    return len(ativos)
+
+
+def registrar_dados(conn: sqlite3.Connection, dados: Dict) -> int:
+    """Grava dados['vinculos'] de xml_indexer.parse_nfe/parse_cte (substitui os anteriores da chave)."""
+    chave = dados.get('chave')
+    if not chave or dados.get('xml_status') != 'COMPLETO':
+        return 0
+    return registrar(conn, dados.get('vinculos') or [], origem=chave)
+
+
+def indexar_arquivo(conn: sqlite3.Connection, caminho, origem: Optional[str] = None) -> int:
+    """Lê o XML (solto ou arquivado) e grava seus vínculos; 0 se ilegível."""
+    dados = ler_bytes(caminho)
+    if not dados:
+        return 0
+    try:
+        vinculos = extrair_vinculos(dados)
+    except Exception as e:
+        logger.debug(f"[VINCULOS] {caminho}: {e}")
+        return 0
+    return registrar(conn, vinculos, origem=origem or next(
+        (v.origem for v in vinculos if v.fonte == 'documento'), None))
+
+
+# ---------------------------------------------------------------------------
+# Consultas
+# ---------------------------------------------------------------------------
+
+def relacionados(conn: sqlite3.Connection, chave: str) -> List[Dict[str, object]]:
+    """
+    Documentos ligados à chave nos dois sentidos, com número/emitente/data de
+    notas_detalhadas e o caminho do XML (quando já baixado).
+    """
+    cur = conn.execute('''
+        SELECT l.chave, l.relacao, l.sentido, l.fonte, n.numero, n.nome_emitente, n.data_emissao,
+               x.caminho_arquivo
+        FROM (
+            SELECT origem AS chave, relacao, 'entrada' AS sentido, fonte FROM doc_links WHERE destino = ?
+            UNION ALL
+            SELECT destino, relacao, 'saida', fonte FROM doc_links WHERE origem = ?
+        ) l
+        LEFT JOIN notas_detalhadas n ON n.chave = l.chave
+        LEFT JOIN xmls_baixados x ON x.chave = l.chave
+        ORDER BY n.data_emissao, l.chave''', (chave, chave))
+    docs = []
+    for outra, relacao, sentido, fonte, numero, emitente, data, caminho in cur.fetchall():
+        docs.append({
+            'chave': outra, 'tipo': tipo_da_chave(outra), 'relacao': relacao, 'sentido': sentido,
+            'descricao': DESCRICOES.get((relacao, sentido), relacao), 'fonte': fonte,
+            'numero': numero or (str(int(outra[25:34])) if len(outra) == 44 else ''),
+            'emitente': emitente, 'data': data, 'caminho': caminho,
+        })
+    return docs
+
+
+def ctes_da_nfe(conn: sqlite3.Connection, chave_nfe: str) -> List[str]:
+    """CT-e (e MDF-e) que transportam a NF-e."""
+    return [r[0] for r in conn.execute(
+        "SELECT origem FROM doc_links WHERE destino = ? AND relacao = 'transporta' ORDER BY origem",
+        (chave_nfe,))]
+
+
+def nfes_transportadas(conn: sqlite3.Connection, chaves_cte: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """CT-e → NF-e transportadas; sem `chaves_cte`, todos os CT-e indexados (conciliação de frete)."""
+    mapa: Dict[str, List[str]] = {}
+    if chaves_cte is None:
+        lotes = [None]
+    else:
+        chaves_cte = list(dict.fromkeys(chaves_cte))
+        lotes = [chaves_cte[i:i + 500] for i in range(0, len(chaves_cte), 500)]
+    for lote in lotes:
+        filtro, params = "", []
+        if lote is not None:
+            if not lote:
+                continue
+            filtro, params = f" AND origem IN ({','.join('?' * len(lote))})", lote
+        for origem, destino in conn.execute(
+                f"SELECT origem, destino FROM doc_links WHERE relacao = 'transporta'{filtro} "
+                "ORDER BY origem, destino", params):
+            mapa.setdefault(origem, []).append(destino)
+    return mapa
+
+
+def backfill_concluido(conn: sqlite3.Connection) -> bool:
+    return marcado(conn, CHAVE_BACKFILL)
+
+
+# ---------------------------------------------------------------------------
+# Varredura única dos XMLs já baixados
+# ---------------------------------------------------------------------------
+
+class IndexadorVinculos(Trabalho):
+    """Varredura única de xmls_baixados + eventos de CT-e/MDF-e; pausar/retomar/cancelar de outra thread."""
+
+    def __init__(self, db_path, lote: int = LOTE_DB):
+        super().__init__()
+        self.db_path = str(db_path)
+        self.lote = max(1, lote)
+
+    def _fontes(self, conn: sqlite3.Connection) -> List[tuple]:
+        """(chave de origem ou None, caminho, xml_completo) a ler."""
+        modelos = ", ".join(f"'{m}'" for m in MODELOS)
+        fontes = conn.execute(
+            f"SELECT chave, caminho_arquivo, xml_completo FROM xmls_baixados "
+            f"WHERE substr(chave, 21, 2) IN ({modelos}) "
+            f"AND (COALESCE(caminho_arquivo, '') <> '' OR COALESCE(xml_completo, '') <> '') "
+            f"ORDER BY chave").fetchall()
+        tipos = ", ".join(f"'{t}'" for t in EVENTOS_VINCULO + EVENTOS_DESVINCULO)
+        try:
+            fontes += [(None, caminho, None) for (caminho,) in conn.execute(
+                f"SELECT DISTINCT caminho FROM eventos WHERE tp_evento IN ({tipos}) "
+                f"AND caminho IS NOT NULL ORDER BY caminho")]
+        except sqlite3.OperationalError:
+            pass   # banco sem o índice de eventos
+        return fontes
+
+    def executar(self, progresso: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        stats = {'documentos': 0, 'vinculos': 0, 'sem_xml': 0, 'total': 0, 'cancelado': False, 'segundos': 0.0}
+        inicio = time.monotonic()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            fontes = self._fontes(conn)
+            stats['total'] = total = len(fontes)
+            logger.info(f"🔗 [VINCULOS] {total} documento(s) para indexar")
+            for i in range(0, total, self.lote):
+                if not self.aguardar():
+                    break
+                with conn:
+                    for chave, caminho, xml_completo in fontes[i:i + self.lote]:
+                        try:
+                            dados = ler_bytes(caminho) if caminho else None
+                            if not dados and xml_completo:
+                                dados = (descompactar(xml_completo) or '').encode('utf-8')   # BLOB NZ ou TEXT legado
+                            if not dados:
+                                stats['sem_xml'] += 1
+                                continue
+                            stats['vinculos'] += registrar(conn, extrair_vinculos(dados), origem=chave)
+                        except Exception as e:
+                            stats['sem_xml'] += 1
+                            logger.debug(f"[VINCULOS] {chave or caminho}: {e}")
+                stats['documentos'] += len(fontes[i:i + self.lote])
+                if progresso:
+                    progresso(stats['documentos'], total, dict(stats))
+            stats['cancelado'] = self.cancelado
+            if not self.cancelado:
+                with conn:
+                    marcar(conn, CHAVE_BACKFILL)
+        finally:
+            conn.close()
+        stats['segundos'] = round(time.monotonic() - inicio, 1)
+        logger.info(
+            f"🔗 [VINCULOS] {'Interrompido' if stats['cancelado'] else 'Concluído'}: "
+            f"{stats['documentos']}/{stats['total']} documento(s) | {stats['vinculos']} vínculo(s) | "
+            f"{stats['sem_xml']} sem XML legível | {stats['segundos']}s"
+        )
+        return stats
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Cache compartilhado de documentos XML já lidos (LRU limitado por tamanho).
+
+O usuário costuma ir e voltar entre PDF, eventos e cancelamento da mesma
+nota. Cada ida fazia tudo de novo: resolve_xml_text abria uma conexão
+SQLite e lia xml_completo (ou o arquivo, solto ou dentro do ZIP mensal), e
+a janela de eventos relia e reparseava com lxml todos os XMLs da pasta
+Eventos do mês. Aqui:
+
+    - documento(chave, carregar): texto da nota + árvore lxml construída
+      sob demanda + campos extraídos memorizados (campo()). A validade é a
+      versão da origem — (mtime, tamanho) do arquivo ou do container
+      mensal; XML vindo do banco (xml_completo) vale até invalidar(chave);
+    - memo_arquivo(caminho, nome, extrator): para varreduras de pasta
+      (eventos, documentos vinculados) guarda só o resultado do extrator
+      por (caminho, mtime) — o texto não fica em memória;
+    - limites: MAX_BYTES de texto e MAX_DOCUMENTOS notas; MAX_ARQUIVOS
+      resultados de varredura. O menos usado sai primeiro.
+
+Thread-safe: o PDFWorker resolve o XML fora da thread da interface.
+
+Uso:
+    cache = obter_cache_documentos()
+    doc = cache.documento(chave, lambda: (texto, caminho_ou_None))
+    evento = evento_do_arquivo(xml_evento, chave)
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from modules.arquivo_mensal import is_caminho_arquivado, ler_xml, separar_caminho
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET  # type: ignore
+
+MAX_BYTES = 48 * 1024 * 1024
+MAX_DOCUMENTOS = 256
+MAX_ARQUIVOS = 20000
+
+ORIGEM_BANCO = 'banco'
+
+NS_NFE = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+NS_VINCULO = {
+    'CTe': ('cte', 'http://www.portalfiscal.inf.br/cte', 'chCTe', 'nCT'),
+    'NFe': ('nfe', 'http://www.portalfiscal.inf.br/nfe', 'chNFe', 'nNF'),
+    'MDFe': ('mdfe', 'http://www.portalfiscal.inf.br/mdfe', 'chMDFe', 'nMDF'),
+}
+
+# Sequências de 44+ dígitos: uma chave citada no XML está sempre dentro de uma
+# delas (o Id de evento cola tpEvento + chave + nSeqEvento num bloco só)
+_RE_DIGITOS = re.compile(r"\d{44,}")
+
+
+def _versao(origem: Optional[str]) -> Optional[Tuple]:
+    """Versão da origem do XML; None se a origem sumiu (entrada inválida)."""
+    if not origem:
+        return (ORIGEM_BANCO,)
+    arquivo = separar_caminho(origem)[0] if is_caminho_arquivado(origem) else str(origem)
+    try:
+        st = os.stat(arquivo)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class DocumentoXML:
+    """Texto do XML, árvore construída na primeira consulta e campos memorizados."""
+
+    __slots__ = ('texto', 'origem', '_arvore', '_campos', '_lock')
+
+    def __init__(self, texto: str, origem: Optional[str] = None):
+        self.texto = texto
+        self.origem = origem
+        self._arvore = None
+        self._campos: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def arvore(self):
+        """Raiz parseada (lxml; ElementTree na falta dele). Propaga erro de parse."""
+        with self._lock:
+            if self._arvore is None:
+                self._arvore = ET.fromstring(self.texto.encode('utf-8'))
+            return self._arvore
+
+    def campo(self, nome: str, extrator: Callable[['DocumentoXML'], Any]) -> Any:
+        """extrator(doc) calculado uma única vez por documento."""
+        with self._lock:
+            if nome not in self._campos:
+                self._campos[nome] = extrator(self)
+            return self._campos[nome]
+
+
+class CacheDocumentos:
+    def __init__(self, max_bytes: int = MAX_BYTES, max_documentos: int = MAX_DOCUMENTOS,
+                 max_arquivos: int = MAX_ARQUIVOS):
+        self.max_bytes = max_bytes
+        self.max_documentos = max_documentos
+        self.max_arquivos = max_arquivos
+        self._docs: "OrderedDict[str, Tuple[Tuple, DocumentoXML]]" = OrderedDict()
+        self._arquivos: "OrderedDict[str, Tuple[Tuple, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    # ------------------------------------------------------------------
+    # Documentos por chave
+    # ------------------------------------------------------------------
+
+    def documento(self, chave: str,
+                  carregar: Callable[[], Optional[Tuple[str, Optional[str]]]]) -> Optional[DocumentoXML]:
+        """
+        Documento da chave. Na falta (ou com a origem alterada) chama
+        carregar() → (texto, caminho de origem ou None se veio do banco).
+        Resultado vazio não é guardado: o XML pode chegar depois.
+        """
+        with self._lock:
+            entrada = self._docs.get(chave)
+        if entrada is not None:
+            versao, doc = entrada
+            if versao == _versao(doc.origem):
+                with self._lock:
+                    if chave in self._docs:
+                        self._docs.move_to_end(chave)
+                    self.acertos += 1
+                return doc
+            self.invalidar([chave])
+        with self._lock:
+            self.faltas += 1
+        resultado = carregar()
+        if not resultado or not resultado[0]:
+            return None
+        texto, origem = resultado
+        return self.registrar(chave, texto, origem)
+
+    def registrar(self, chave: str, texto: str, origem: Optional[str] = None) -> DocumentoXML:
+        """Guarda (ou substitui) o documento da chave — p.ex. logo após um download."""
+        doc = DocumentoXML(texto, origem)
+        versao = _versao(origem)
+        if versao is None or len(texto) > self.max_bytes:
+            return doc
+        with self._lock:
+            self._remover(chave)
+            self._docs[chave] = (versao, doc)
+            self._bytes += len(texto)
+            while self._docs and (self._bytes > self.max_bytes or len(self._docs) > self.max_documentos):
+                self._remover(next(iter(self._docs)))
+        return doc
+
+    def origem(self, chave: str) -> Optional[str]:
+        """Caminho de onde veio o XML em cache (None se não está em cache ou veio do banco)."""
+        with self._lock:
+            entrada = self._docs.get(chave)
+        return entrada[1].origem if entrada is not None else None
+
+    def invalidar(self, chaves: Optional[Iterable[str]] = None):
+        """Descarta as chaves dadas (todas, sem argumento)."""
+        with self._lock:
+            if chaves is None:
+                self._docs.clear()
+                self._arquivos.clear()
+                self._bytes = 0
+                return
+            for chave in chaves:
+                self._remover(chave)
+
+    def _remover(self, chave: str):
+        entrada = self._docs.pop(chave, None)
+        if entrada is not None:
+            self._bytes -= len(entrada[1].texto)
+
+    # ------------------------------------------------------------------
+    # Resultados de varredura por arquivo
+    # ------------------------------------------------------------------
+
+    def memo_arquivo(self, caminho, nome: str, extrator: Callable[[DocumentoXML], Any]) -> Any:
+        """extrator(doc) do arquivo, recalculado só quando o arquivo muda; None se não existe."""
+        caminho = str(caminho)
+        versao = _versao(caminho)
+        if versao is None:
+            return None
+        with self._lock:
+            entrada = self._arquivos.get(caminho)
+            if entrada is not None and entrada[0] == versao and nome in entrada[1]:
+                self._arquivos.move_to_end(caminho)
+                self.acertos += 1
+                return entrada[1][nome]
+            self.faltas += 1
+        texto = ler_xml(caminho)
+        if texto is None:
+            return None
+        valor = extrator(DocumentoXML(texto, caminho))
+        with self._lock:
+            entrada = self._arquivos.get(caminho)
+            if entrada is None or entrada[0] != versao:
+                entrada = (versao, {})
+            entrada[1][nome] = valor
+            self._arquivos[caminho] = entrada
+            self._arquivos.move_to_end(caminho)
+            while len(self._arquivos) > self.max_arquivos:
+                self._arquivos.popitem(last=False)
+        return valor
+
+    def estatisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {'documentos': len(self._docs), 'bytes': self._bytes, 'arquivos': len(self._arquivos),
+                    'acertos': self.acertos, 'faltas': self.faltas}
+
+
+# ---------------------------------------------------------------------------
+# Extratores usados pelas janelas de eventos/cancelamento
+# ---------------------------------------------------------------------------
+
+def _primeiro(arvore, caminhos, ns=None) -> Optional[str]:
+    for caminho in caminhos:
+        valor = arvore.findtext(caminho, namespaces=ns) if ns else arvore.findtext(caminho)
+        if valor:
+            return valor
+    return None
+
+
+def extrair_evento(doc: DocumentoXML) -> Optional[Dict[str, str]]:
+    """tpEvento, descrição, data, cStat e xMotivo do XML de evento (None se ilegível)."""
+    try:
+        arvore = doc.arvore
+    except Exception:
+        return None
+    if arvore.tag == 'statusSEFAZ':  # arquivo sintético gerado pelo "Consultar SEFAZ"
+        cstat = arvore.findtext('cStat') or 'N/A'
+        xmotivo = arvore.findtext('xMotivo') or 'N/A'
+        return {'tp_evento': arvore.findtext('tpEvento') or 'STATUS',
+                'descricao': f"cStat {cstat}: {xmotivo}",
+                'data': arvore.findtext('dhRecbto') or 'N/A',
+                'cstat': cstat, 'xmotivo': xmotivo}
+    q = lambda *nomes: (_primeiro(arvore, [f'.//nfe:{n}' for n in nomes], NS_NFE)
+                        or _primeiro(arvore, [f'.//{n}' for n in nomes]) or 'N/A')
+    return {'tp_evento': q('tpEvento'),
+            'descricao': q('descEvento', 'xEvento'),
+            'data': q('dhEvento', 'dhRegEvento', 'dhRecbto'),
+            'cstat': q('cStat'),
+            'xmotivo': q('xMotivo')}
+
+
+def extrair_vinculo(doc: DocumentoXML, pasta_tipo: str) -> Optional[Dict[str, Optional[str]]]:
+    """Chave, número, emitente e data de um CT-e/NF-e/MDF-e que cita outra nota."""
+    if pasta_tipo not in NS_VINCULO:
+        return None
+    try:
+        arvore = doc.arvore
+    except Exception:
+        return None
+    prefixo, uri, tag_chave, tag_numero = NS_VINCULO[pasta_tipo]
+    ns = {prefixo: uri}
+    q = lambda nome: (arvore.findtext(f'.//{prefixo}:{nome}', namespaces=ns) or arvore.findtext(f'.//{nome}'))
+    return {'chave': q(tag_chave), 'numero': q(tag_numero), 'emitente': q('xNome'), 'data': q('dhEmi')}
+
+
+def _sequencias(doc: DocumentoXML) -> Tuple[str, ...]:
+    return tuple(_RE_DIGITOS.findall(doc.texto))
+
+
+def cita_chave(caminho, chave: str, cache: Optional[CacheDocumentos] = None) -> bool:
+    """Equivale a `chave in arquivo.read_text()`, sem reler arquivos que não mudaram."""
+    cache = cache or obter_cache_documentos()
+    sequencias = cache.memo_arquivo(caminho, 'chaves', _sequencias)
+    return bool(sequencias) and any(chave in s for s in sequencias)
+
+
+def evento_do_arquivo(caminho, chave: str,
+                      cache: Optional[CacheDocumentos] = None) -> Optional[Dict[str, str]]:
+    """Campos do evento se o arquivo cita a chave; None caso contrário."""
+    cache = cache or obter_cache_documentos()
+    if not cita_chave(caminho, chave, cache):
+        return None
+    return cache.memo_arquivo(caminho, 'evento', extrair_evento)
+
+
+def vinculo_do_arquivo(caminho, chave: str, pasta_tipo: str,
+                       cache: Optional[CacheDocumentos] = None) -> Optional[Dict[str, Optional[str]]]:
+    """Campos do documento vinculado se o arquivo cita a chave; None caso contrário."""
+    cache = cache or obter_cache_documentos()
+    if not cita_chave(caminho, chave, cache):
+        return None
+    return cache.memo_arquivo(caminho, f'vinculo_{pasta_tipo}', lambda d: extrair_vinculo(d, pasta_tipo))
+
+
+_cache: Optional[CacheDocumentos] = None
+_cache_lock = threading.Lock()
+
+
+def obter_cache_documentos() -> CacheDocumentos:
+    """Instância única no processo (compartilhada por todas as janelas)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheDocumentos()
+        return _cache
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Download das NF-e que chegaram só como resumo (Fase 1.5 do ciclo).
+
+baixar_resumos_pendentes fazia, nota a nota: Ciência da Operação, 3 s de
+espera, consChNFe; a SEFAZ demora a liberar o XML depois da Ciência, então
+o ciclo passava a maior parte do tempo dormindo — e nota que não vinha era
+tentada de novo em todo ciclo. Agora, por certificado (em paralelo):
+
+    1. as Ciências saem em rajada, sem espera entre elas;
+    2. cada nota ganha um horário de download (Ciência + ESPERAS_RECHECK[0])
+       e, se o XML ainda não estiver liberado, novas tentativas em intervalos
+       crescentes (ESPERAS_RECHECK) — as Ciências pendentes são enviadas
+       enquanto os downloads não vencem;
+    3. a nota que continua sem XML fica INDISPONIVEL com data de nova
+       tentativa (tabela resumos_download, migração 8; BACKOFF_INDISPONIVEL)
+       e só volta ao lote quando a data vence.
+
+O download devolve uma situação:
+    OK          XML completo salvo
+    AGUARDAR    SEFAZ ainda não liberou (resumo/137) — reagenda
+    BLOQUEADO   656 — o certificado para neste ciclo
+    PERMANENTE  rejeição definitiva (632/633/634/653) — já marcada pelo chamador
+    ERRO        sem resposta/exceção — fica para o próximo ciclo
+
+Uso:
+    pipeline = PipelineResumos(ciencia, baixar)
+    finais = pipeline.executar(itens)      # {chave: situação}
+"""
+from __future__ import annotations
+
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger('nfe_search')
+
+OK = 'ok'
+AGUARDAR = 'aguardar'
+BLOQUEADO = 'bloqueado'
+PERMANENTE = 'permanente'
+ERRO = 'erro'
+
+HORA = 3600
+DIA = 24 * HORA
+
+ESPERAS_RECHECK = (10, 30, 90)          # segundos após a Ciência / entre tentativas no ciclo
+BACKOFF_INDISPONIVEL = (HORA, 6 * HORA, DIA, 3 * DIA, 7 * DIA)
+MAX_RETENTATIVAS = 8                    # ciclos INDISPONIVEL antes de desistir de vez
+MAX_CERTIFICADOS_PARALELOS = 4
+
+
+@dataclass
+class ItemResumo:
+    chave: str
+    certificado: str          # chave de agrupamento (CNPJ do certificado)
+    precisa_ciencia: bool = True
+
+
+def criar_tabela(conn: sqlite3.Connection):
+    """Cria resumos_download (migração)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS resumos_download (
+        chave TEXT PRIMARY KEY,
+        informante TEXT NOT NULL DEFAULT '',
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        proxima_tentativa INTEGER,
+        ultimo_cstat TEXT,
+        atualizado_em INTEGER
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_resumos_download_proxima "
+                 "ON resumos_download(proxima_tentativa)")
+
+
+def pendentes(conn: sqlite3.Connection, agora: Optional[float] = None) -> List[Tuple[str, str]]:
+    """
+    (chave, informante) das NF-e a baixar: RESUMO fora de espera e
+    INDISPONIVEL cuja data de nova tentativa venceu. INDISPONIVEL sem linha
+    na agenda (rejeição definitiva) não volta.
+    """
+    agora = int(time.time() if agora is None else agora)
+    return conn.execute('''
+        SELECT n.chave, n.informante FROM notas_detalhadas n
+        LEFT JOIN resumos_download r ON r.chave = n.chave
+        WHERE n.tipo IN ('NFe', 'NF-e') AND (
+              (n.xml_status = 'RESUMO' AND (r.proxima_tentativa IS NULL OR r.proxima_tentativa <= ?))
+           OR (n.xml_status = 'INDISPONIVEL' AND r.proxima_tentativa <= ?))
+        ORDER BY n.data_emissao DESC
+    ''', (agora, agora)).fetchall()
+
+
+def marcar_indisponivel(conn: sqlite3.Connection, chave: str, informante: str, cstat: str = '',
+                        agora: Optional[float] = None) -> Optional[int]:
+    """
+    Nota sem XML depois das tentativas do ciclo: INDISPONIVEL e próxima
+    tentativa pelo BACKOFF_INDISPONIVEL. Retorna o epoch da nova tentativa
+    (None = desistiu após MAX_RETENTATIVAS; a nota fica INDISPONIVEL de vez).
+    """
+    agora = int(time.time() if agora is None else agora)
+    row = conn.execute("SELECT tentativas FROM resumos_download WHERE chave = ?", (chave,)).fetchone()
+    tentativas = (row[0] if row else 0) + 1
+    proxima = None
+    if tentativas < MAX_RETENTATIVAS:
+        proxima = agora + BACKOFF_INDISPONIVEL[min(tentativas - 1, len(BACKOFF_INDISPONIVEL) - 1)]
+    conn.execute('''
+        INSERT INTO resumos_download (chave, informante, tentativas, proxima_tentativa, ultimo_cstat, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(chave) DO UPDATE SET
+            tentativas = excluded.tentativas,
+            proxima_tentativa = excluded.proxima_tentativa,
+            ultimo_cstat = excluded.ultimo_cstat,
+            atualizado_em = excluded.atualizado_em
+    ''', (chave, informante or '', tentativas, proxima, cstat or '', agora))
+    conn.execute("UPDATE notas_detalhadas SET xml_status = 'INDISPONIVEL' "
+                 "WHERE chave = ? AND xml_status IN ('RESUMO', 'INDISPONIVEL')", (chave,))
+    return proxima
+
+
+def concluir(conn: sqlite3.Connection, chave: str):
+    """Baixada ou rejeitada de vez: sai da agenda."""
+    conn.execute("DELETE FROM resumos_download WHERE chave = ?", (chave,))
+
+
+class PipelineResumos:
+    """
+    Ciência + download por certificado, certificados em paralelo.
+
+    Args:
+        ciencia: envia a Ciência de UMA chave; retorna True se foi enviada
+            agora (o download espera a SEFAZ liberar o XML).
+        baixar: tenta baixar UMA chave; retorna OK/AGUARDAR/BLOQUEADO/PERMANENTE/ERRO.
+    """
+
+    def __init__(self, ciencia: Callable[[ItemResumo], bool],
+                 baixar: Callable[[ItemResumo], str],
+                 esperas: Sequence[float] = ESPERAS_RECHECK,
+                 max_paralelos: int = MAX_CERTIFICADOS_PARALELOS,
+                 relogio: Callable[[], float] = time.monotonic,
+                 dormir: Callable[[float], None] = time.sleep):
+        self.ciencia = ciencia
+        self.baixar = baixar
+        self.esperas = tuple(esperas)
+        self.max_paralelos = max(1, max_paralelos)
+        self._relogio = relogio
+        self._dormir = dormir
+        self._lock = threading.Lock()
+        self.finais: Dict[str, str] = {}
+
+    def _finalizar(self, chave: str, situacao: str):
+        with self._lock:
+            self.finais[chave] = situacao
+
+    def _certificado(self, itens: List[ItemResumo]):
+        """Uma linha do tempo por certificado: Ciências pendentes e downloads agendados."""
+        cientificar = [i for i in itens if i.precisa_ciencia]
+        agenda: List[Tuple[float, int, int, ItemResumo]] = []  # (vence, ordem, tentativa, item)
+        ordem = 0
+        for item in itens:
+            if not item.precisa_ciencia:
+                heapq.heappush(agenda, (self._relogio(), ordem, 0, item))
+                ordem += 1
+
+        while cientificar or agenda:
+            if agenda and (agenda[0][0] <= self._relogio() or not cientificar):
+                vence, _, tentativa, item = heapq.heappop(agenda)
+                espera = vence - self._relogio()
+                if espera > 0:
+                    self._dormir(espera)
+                try:
+                    situacao = self.baixar(item)
+                except Exception as e:
+                    logger.error(f"❌ [RESUMO] Erro ao baixar {item.chave}: {e}")
+                    situacao = ERRO
+                if situacao == AGUARDAR and tentativa + 1 < len(self.esperas):
+                    heapq.heappush(agenda, (self._relogio() + self.esperas[tentativa + 1],
+                                            ordem, tentativa + 1, item))
+                    ordem += 1
+                    continue
+                self._finalizar(item.chave, situacao)
+                if situacao == BLOQUEADO:
+                    logger.warning(f"⚠️ [RESUMO] Rate limit SEFAZ (656) para cert {item.certificado} — "
+                                   f"{len(agenda) + len(cientificar)} nota(s) ficam para o próximo ciclo")
+                    for *_, restante in agenda:
+                        self._finalizar(restante.chave, BLOQUEADO)
+                    for restante in cientificar:
+                        self._finalizar(restante.chave, BLOQUEADO)
+                    return
+                continue
+
+            item = cientificar.pop(0)
+            try:
+                enviada = self.ciencia(item)
+            except Exception as e:
+                logger.error(f"❌ [RESUMO] Erro ao enviar Ciência para {item.chave}: {e}")
+                enviada = False
+            vence = self._relogio() + (self.esperas[0] if enviada and self.esperas else 0)
+            heapq.heappush(agenda, (vence, ordem, 0, item))
+            ordem += 1
+
+    def executar(self, itens: Iterable[ItemResumo]) -> Dict[str, str]:
+        """Processa todos os itens; retorna {chave: situação final}."""
+        por_certificado: Dict[str, List[ItemResumo]] = {}
+        for item in itens:
+            por_certificado.setdefault(item.certificado, []).append(item)
+        if not por_certificado:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_paralelos, len(por_certificado)),
+                                thread_name_prefix='resumos') as pool:
+            for futuro in [pool.submit(self._certificado, lista) for lista in por_certificado.values()]:
+                futuro.result()
+        return dict(self.finais)
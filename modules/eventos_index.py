@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de eventos (cancelamento, CC-e, ciência, desacordo...) no banco.
+
+Os eventos ficam como arquivos em pastas Eventos/ e eram descobertos
+varrendo pastas e nomes de arquivo: a janela de eventos e a verificação de
+cancelamento liam todos os XMLs do mês a cada abertura, e
+processar_evento_status aplicava o status evento a evento. A tabela
+`eventos` guarda uma linha por (chave, tpEvento, nSeqEvento):
+
+    c_stat, x_motivo, protocolo, descricao, dh_evento, dh_registro,
+    caminho (arquivo do evento — reapontado pelo arquivo mensal), informante
+
+    - registrar()/indexar_arquivo() na ingestão (nfe_search e os pontos da
+      interface que gravam XML de evento); indexar_arquivo também grava em
+      doc_links os CT-e/MDF-e que os eventos 6101xx–6106xx ligam à NF-e;
+    - IndexadorEventos: varredura única das pastas Eventos/ existentes
+      (Gerenciador de Trabalhos); ao terminar marca CHAVE_BACKFILL em config;
+    - consultas: eventos_da_chave() (janela de eventos), cancelada()/
+      chaves_canceladas()/sql_cancelada() (filtro "Cancelado") e
+      derivar_status(), que grava o status das notas a partir do índice.
+
+Uso:
+    with sqlite3.connect(db_path) as conn:
+        indexar_arquivo(conn, caminho_evento, informante)
+        derivar_status(conn, [chave])
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET  # type: ignore
+
+from modules.arquivo_mensal import ler_bytes, montar_caminho
+from modules.doc_links import extrair_vinculos, registrar as registrar_vinculos
+from modules.trabalho_paginado import Trabalho, marcado, marcar
+
+logger = logging.getLogger('nfe_search')
+
+CHAVE_BACKFILL = 'eventos_index_backfill'
+LOTE_DB = 500               # arquivos por transação na varredura
+
+TIPOS_CANCELAMENTO = ('110111', '110112')   # cancelamento / cancelamento por substituição (NFC-e)
+TIPO_CORRECAO = '110110'
+# Evento registrado (135/136/155) ou situação cancelada no status sintético (101/151).
+# Sem cStat (resEvento) o evento já chegou registrado; o statusSEFAZ sintético
+# (nSeqEvento 0) só é gravado como 110111 quando a consulta concluiu o cancelamento.
+CSTAT_VALIDOS = ('135', '136', '155', '101', '151')
+
+STATUS_CANCELADA = {'57': "Cancelamento de CT-e homologado"}
+STATUS_CANCELADA_PADRAO = "Cancelamento de NF-e homologado"
+STATUS_CORRECAO = "Carta de Correção registrada"
+
+_CONTAINERS = ('procEventoNFe', 'procEventoCTe', 'procEventoMDFe')
+_CAMPOS = {
+    'chNFe': 'chave', 'chCTe': 'chave', 'chMDFe': 'chave',
+    'tpEvento': 'tp_evento', 'nSeqEvento': 'n_seq_evento',
+    'cStat': 'c_stat', 'xMotivo': 'x_motivo', 'nProt': 'protocolo',
+    'descEvento': 'descricao', 'xEvento': 'descricao',
+    'dhEvento': 'dh_evento', 'dhRegEvento': 'dh_registro', 'dhRecbto': 'dh_registro',
+}
+_COLUNAS = ('chave', 'tp_evento', 'n_seq_evento', 'c_stat', 'x_motivo', 'protocolo',
+            'descricao', 'dh_evento', 'dh_registro')
+
+
+@dataclass
+class Evento:
+    chave: str
+    tp_evento: str
+    n_seq_evento: int = 1
+    c_stat: Optional[str] = None
+    x_motivo: Optional[str] = None
+    protocolo: Optional[str] = None
+    descricao: Optional[str] = None
+    dh_evento: Optional[str] = None
+    dh_registro: Optional[str] = None
+
+
+def criar_tabela(conn: sqlite3.Connection):
+    """Cria a tabela eventos (migração)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS eventos (
+        chave TEXT NOT NULL,
+        tp_evento TEXT NOT NULL,
+        n_seq_evento INTEGER NOT NULL DEFAULT 1,
+        c_stat TEXT,
+        x_motivo TEXT,
+        protocolo TEXT,
+        descricao TEXT,
+        dh_evento TEXT,
+        dh_registro TEXT,
+        caminho TEXT,
+        informante TEXT,
+        indexado_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        PRIMARY KEY (chave, tp_evento, n_seq_evento)
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_eventos_tipo ON eventos(tp_evento, chave)")
+
+
+# ---------------------------------------------------------------------------
+# Extração
+# ---------------------------------------------------------------------------
+
+def _local(tag) -> str:
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def _evento_de(elemento) -> Optional[Evento]:
+    """Primeira ocorrência de cada campo dentro do elemento (evento + retEvento)."""
+    campos: Dict[str, str] = {}
+    for el in elemento.iter():
+        destino = _CAMPOS.get(_local(el.tag))
+        if destino and destino not in campos and el.text and el.text.strip():
+            campos[destino] = el.text.strip()
+    chave = campos.get('chave', '')
+    if len(chave) != 44 or not chave.isdigit() or not campos.get('tp_evento'):
+        return None
+    try:
+        seq = int(campos.get('n_seq_evento') or 1)
+    except ValueError:
+        seq = 1
+    return Evento(chave, campos['tp_evento'], seq, campos.get('c_stat'), campos.get('x_motivo'),
+                  campos.get('protocolo'), campos.get('descricao'), campos.get('dh_evento'),
+                  campos.get('dh_registro'))
+
+
+def extrair_eventos(dados: Union[bytes, str]) -> List[Evento]:
+    """
+    Eventos contidos num XML: procEvento* (um ou vários), retEnvEvento
+    (resposta de manifestação, um retEvento por evento), resEvento, evento
+    avulso ou o statusSEFAZ sintético do "Consultar SEFAZ" (nSeqEvento 0).
+    """
+    if isinstance(dados, str):
+        dados = dados.encode('utf-8')
+    raiz = ET.fromstring(dados)
+    if _local(raiz.tag) == 'statusSEFAZ':
+        chave = (raiz.findtext('chave') or '').strip()
+        if len(chave) != 44:
+            return []
+        cstat, xmotivo = raiz.findtext('cStat'), raiz.findtext('xMotivo')
+        return [Evento(chave, (raiz.findtext('tpEvento') or 'STATUS').strip(), 0, cstat, xmotivo,
+                       raiz.findtext('nProt') or None, f"cStat {cstat}: {xmotivo}", None,
+                       raiz.findtext('dhRecbto') or None)]
+    containers = [el for el in raiz.iter() if _local(el.tag) in _CONTAINERS]
+    if not containers:
+        containers = [el for el in raiz.iter() if _local(el.tag) == 'retEvento'] or [raiz]
+    return [ev for ev in map(_evento_de, containers) if ev is not None]
+
+
+# ---------------------------------------------------------------------------
+# Gravação
+# ---------------------------------------------------------------------------
+
+_SQL_UPSERT = f'''
+    INSERT INTO eventos ({', '.join(_COLUNAS)}, caminho, informante)
+    VALUES ({', '.join('?' * (len(_COLUNAS) + 2))})
+    ON CONFLICT(chave, tp_evento, n_seq_evento) DO UPDATE SET
+        {', '.join(f"{c} = COALESCE(excluded.{c}, {c})" for c in _COLUNAS[3:])},
+        caminho = COALESCE(excluded.caminho, caminho),
+        informante = COALESCE(excluded.informante, informante)
+'''
+
+
+def registrar(conn: sqlite3.Connection, eventos: Iterable[Evento], caminho: Optional[str] = None,
+              informante: Optional[str] = None) -> int:
+    """Insere/atualiza os eventos (campos ausentes não apagam o que já havia)."""
+    linhas = [tuple(getattr(ev, c) for c in _COLUNAS) + (caminho, informante or None) for ev in eventos]
+    conn.executemany(_SQL_UPSERT, linhas)
+    return len(linhas)
+
+
+def indexar_arquivo(conn: sqlite3.Connection, caminho, informante: Optional[str] = None) -> int:
+    """Lê o XML de evento (solto ou arquivado) e registra seus eventos; 0 se ilegível."""
+    dados = ler_bytes(caminho)
+    if not dados:
+        return 0
+    try:
+        eventos = extrair_eventos(dados)
+        vinculos = extrair_vinculos(dados)
+    except Exception as e:
+        logger.debug(f"[EVENTOS-INDICE] {caminho}: {e}")
+        return 0
+    registrar_vinculos(conn, vinculos)   # evento de CT-e/MDF-e emitido para a NF-e
+    return registrar(conn, eventos, str(caminho), informante)
+
+
+def indexar_no_banco(db_path: Union[str, Path], caminho, informante: Optional[str] = None) -> int:
+    """indexar_arquivo + derivar_status numa conexão própria (pontos de gravação da interface)."""
+    with sqlite3.connect(str(db_path), timeout=30) as conn:
+        n = indexar_arquivo(conn, caminho, informante)
+        if n:
+            chaves = [r[0] for r in conn.execute(
+                "SELECT DISTINCT chave FROM eventos WHERE caminho = ?", (str(caminho),))]
+            derivar_status(conn, chaves)
+    return n
+
+
+# ---------------------------------------------------------------------------
+# Consultas
+# ---------------------------------------------------------------------------
+
+def _sql_registrado(prefixo: str = "") -> str:
+    validos = ", ".join(f"'{c}'" for c in CSTAT_VALIDOS)
+    return (f"({prefixo}c_stat IS NULL OR {prefixo}c_stat IN ({validos}) "
+            f"OR {prefixo}n_seq_evento = 0)")
+
+
+def sql_cancelada(coluna_chave: str = "chave") -> str:
+    """Condição SQL "a nota tem cancelamento registrado" (usa a chave primária de eventos)."""
+    tipos = ", ".join(f"'{t}'" for t in TIPOS_CANCELAMENTO)
+    return (f"EXISTS (SELECT 1 FROM eventos e WHERE e.chave = {coluna_chave} "
+            f"AND e.tp_evento IN ({tipos}) AND {_sql_registrado('e.')})")
+
+
+def cancelada(conn: sqlite3.Connection, chave: str) -> bool:
+    return conn.execute(f"SELECT {sql_cancelada('?')}", (chave,)).fetchone()[0] == 1
+
+
+def chaves_canceladas(conn: sqlite3.Connection) -> Set[str]:
+    """Todas as chaves com cancelamento registrado (índice tp_evento, chave)."""
+    tipos = ", ".join(f"'{t}'" for t in TIPOS_CANCELAMENTO)
+    return {r[0] for r in conn.execute(
+        f"SELECT DISTINCT chave FROM eventos WHERE tp_evento IN ({tipos}) AND {_sql_registrado()}")}
+
+
+def eventos_da_chave(conn: sqlite3.Connection, chave: str) -> List[Dict[str, object]]:
+    """Eventos da nota em ordem cronológica (registro, depois emissão do evento)."""
+    cur = conn.execute(
+        f"SELECT {', '.join(_COLUNAS)}, caminho, informante FROM eventos WHERE chave = ? "
+        "ORDER BY COALESCE(dh_registro, dh_evento, ''), tp_evento, n_seq_evento", (chave,))
+    nomes = [d[0] for d in cur.description]
+    return [dict(zip(nomes, row)) for row in cur.fetchall()]
+
+
+def derivar_status(conn: sqlite3.Connection, chaves: Optional[Iterable[str]] = None) -> int:
+    """
+    Grava em notas_detalhadas o status que os eventos indexados determinam
+    (cancelamento vence CC-e; só muda quem ainda não está com esse status).
+    Sem `chaves`, aplica no banco inteiro. Devolve quantas notas mudaram.
+    """
+    filtros = [""]
+    params_lotes: List[list] = [[]]
+    if chaves is not None:
+        chaves = [c for c in dict.fromkeys(chaves) if c]
+        if not chaves:
+            return 0
+        params_lotes = [chaves[i:i + 500] for i in range(0, len(chaves), 500)]
+        filtros = [f" AND chave IN ({','.join('?' * len(p))})" for p in params_lotes]
+    texto_cancelada = (" CASE substr(chave, 21, 2) "
+                       + " ".join(f"WHEN '{m}' THEN '{t}'" for m, t in STATUS_CANCELADA.items())
+                       + f" ELSE '{STATUS_CANCELADA_PADRAO}' END")
+    alteradas = 0
+    for filtro, params in zip(filtros, params_lotes):
+        alteradas += conn.execute(
+            f"UPDATE notas_detalhadas SET status = {texto_cancelada} "
+            f"WHERE lower(COALESCE(status, '')) NOT LIKE '%cancel%' AND {sql_cancelada('notas_detalhadas.chave')}"
+            f"{filtro}", params).rowcount
+        alteradas += conn.execute(
+            f"UPDATE notas_detalhadas SET status = ? "
+            f"WHERE COALESCE(status, '') <> ? AND lower(COALESCE(status, '')) NOT LIKE '%cancel%' "
+            f"AND EXISTS (SELECT 1 FROM eventos e WHERE e.chave = notas_detalhadas.chave "
+            f"AND e.tp_evento = '{TIPO_CORRECAO}' AND {_sql_registrado('e.')})"
+            f"{filtro}", [STATUS_CORRECAO, STATUS_CORRECAO] + list(params)).rowcount
+    return alteradas
+
+
+def backfill_concluido(conn: sqlite3.Connection) -> bool:
+    return marcado(conn, CHAVE_BACKFILL)
+
+
+# ---------------------------------------------------------------------------
+# Varredura única das pastas existentes
+# ---------------------------------------------------------------------------
+
+def _informante_de(relativo: Path) -> Optional[str]:
+    """Primeiro componente só com dígitos (xmls/{CNPJ}/... ou xmls/{TIPO}/{CNPJ}/...)."""
+    for parte in relativo.parts[:3]:
+        if parte.isdigit() and len(parte) in (11, 14):
+            return parte
+    return None
+
+
+def listar_arquivos_eventos(pasta_xmls: Union[str, Path]) -> List[tuple]:
+    """(caminho, informante) de todo XML sob uma pasta Eventos/, solto ou no ZIP mensal."""
+    pasta_xmls = Path(pasta_xmls)
+    arquivos = []
+    if not pasta_xmls.is_dir():
+        return arquivos
+    for raiz, dirs, nomes in os.walk(pasta_xmls):
+        dirs[:] = [d for d in dirs if d.lower() not in ('debug', 'backup', 'debug de notas')]
+        raiz_path = Path(raiz)
+        relativo = raiz_path.relative_to(pasta_xmls)
+        em_eventos = 'Eventos' in relativo.parts
+        for nome in nomes:
+            caminho = raiz_path / nome
+            baixo = nome.lower()
+            if em_eventos and baixo.endswith('.xml'):
+                arquivos.append((str(caminho), _informante_de(relativo)))
+            elif baixo.endswith('.zip'):
+                try:
+                    with zipfile.ZipFile(caminho) as zf:
+                        membros = [m for m in zf.namelist()
+                                   if m.lower().endswith('.xml') and 'Eventos' in m.split('/')[:-1]]
+                except (OSError, zipfile.BadZipFile):
+                    continue
+                informante = _informante_de(relativo)
+                arquivos.extend((montar_caminho(caminho, m), informante) for m in membros)
+    return arquivos
+
+
+class IndexadorEventos(Trabalho):
+    """Varredura única das pastas Eventos/; pausar/retomar/cancelar podem vir de outra thread."""
+
+    def __init__(self, db_path: Union[str, Path], pasta_xmls: Union[str, Path], lote: int = LOTE_DB):
+        super().__init__()
+        self.db_path = str(db_path)
+        self.pasta_xmls = pasta_xmls
+        self.lote = max(1, lote)
+
+    def executar(self, progresso: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """Indexa todos os arquivos e deriva o status das notas; progresso(feitos, total, stats) por lote."""
+        stats = {'arquivos': 0, 'eventos': 0, 'ilegiveis': 0, 'status_alterados': 0,
+                 'total': 0, 'cancelado': False, 'segundos': 0.0}
+        inicio = time.monotonic()
+        arquivos = listar_arquivos_eventos(self.pasta_xmls)
+        stats['total'] = total = len(arquivos)
+        logger.info(f"📋 [EVENTOS-INDICE] {total} arquivo(s) de evento para indexar")
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            for i in range(0, total, self.lote):
+                if not self.aguardar():
+                    break
+                with conn:
+                    for caminho, informante in arquivos[i:i + self.lote]:
+                        n = indexar_arquivo(conn, caminho, informante)
+                        stats['eventos'] += n
+                        stats['ilegiveis'] += 0 if n else 1
+                stats['arquivos'] += len(arquivos[i:i + self.lote])
+                if progresso:
+                    progresso(stats['arquivos'], total, dict(stats))
+            stats['cancelado'] = self.cancelado
+            if not self.cancelado:
+                with conn:
+                    stats['status_alterados'] = derivar_status(conn)
+                    marcar(conn, CHAVE_BACKFILL)
+        finally:
+            conn.close()
+        stats['segundos'] = round(time.monotonic() - inicio, 1)
+        logger.info(
+            f"📋 [EVENTOS-INDICE] {'Interrompido' if stats['cancelado'] else 'Concluído'}: "
+            f"{stats['arquivos']}/{total} arquivo(s) | {stats['eventos']} evento(s) | "
+            f"{stats['ilegiveis']} sem evento/ilegível(is) | {stats['status_alterados']} status derivado(s) | "
+            f"{stats['segundos']}s"
+        )
+        return stats
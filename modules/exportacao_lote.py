@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Exportação em lote (menu Exportar) direto para ZIP ou pasta.
+
+_executar_exportacao fazia, por linha selecionada e na thread da interface:
+_encontrar_arquivo_xml + _encontrar_arquivo_pdf (várias consultas e testes de
+caminho cada) e shutil.copy2. Com 50 mil documentos a janela congelava por
+muito tempo. Aqui:
+
+    1. localizar_em_lote resolve metadados e caminhos candidatos de todas as
+       chaves com uma consulta por lote de LOTE_SQL chaves (notas_detalhadas
+       + xmls_caminhos + xmls_baixados);
+    2. leitores em paralelo (ThreadPoolExecutor) leem os arquivos — soltos
+       ou de dentro do arquivo mensal — com janela limitada de documentos
+       em voo (a memória não cresce com o tamanho da seleção);
+    3. um único escritor grava no destino: DestinoZip (um .zip gravado em
+       temporário e trocado com os.replace no final; PDF armazenado sem
+       recompressão) ou DestinoPasta;
+    4. a organização das pastas vem de LAYOUTS (por mês, emitente, tipo...);
+    5. PDFs que faltam são gerados em lote (modules/pdf_lote): o XML vai
+       para uma pasta temporária assim que é lido (só o caminho fica na
+       memória) e o PDF entra no destino como os demais.
+
+Uso:
+    docs = localizar_em_lote(conn, chaves)
+    exportador = ExportadorLote(DestinoZip("export.zip"), layout='mes')
+    stats = exportador.executar([docs[c] for c in chaves if c in docs])
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from modules.arquivo_mensal import caminho_solto, ler_bytes
+
+logger = logging.getLogger('nfe_search')
+
+LOTE_SQL = 500
+LEITORES = 8
+JANELA_POR_LEITOR = 4
+
+# Subpasta de cada documento dentro do destino
+LAYOUTS = {
+    'plano': "",
+    'mes': "{ano_mes}",
+    'emitente': "{cnpj_emitente}",
+    'tipo': "{tipo}",
+    'mes_tipo': "{ano_mes}/{tipo}",
+}
+
+_INVALIDOS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+@dataclass
+class DocumentoExportacao:
+    chave: str
+    tipo: str = ''
+    numero: str = ''
+    nome_emitente: str = ''
+    cnpj_emitente: str = ''
+    data_emissao: str = ''
+    xmls: List[str] = field(default_factory=list)   # candidatos, na ordem de preferência
+    pdfs: List[str] = field(default_factory=list)
+
+
+def localizar_em_lote(conn, chaves: Sequence[str]) -> Dict[str, DocumentoExportacao]:
+    """chave → DocumentoExportacao; chaves fora de notas_detalhadas não aparecem."""
+    docs: Dict[str, DocumentoExportacao] = {}
+    chaves = list(dict.fromkeys(chaves))
+    for i in range(0, len(chaves), LOTE_SQL):
+        lote = chaves[i:i + LOTE_SQL]
+        marcas = ','.join('?' * len(lote))
+        linhas = conn.execute(f'''
+            SELECT n.chave, n.tipo, n.numero, n.nome_emitente, n.cnpj_emitente, n.data_emissao,
+                   n.pdf_path, c.caminho, b.caminho_arquivo
+            FROM notas_detalhadas n
+            LEFT JOIN xmls_caminhos c ON c.chave = n.chave
+            LEFT JOIN xmls_baixados b ON b.chave = n.chave
+            WHERE n.chave IN ({marcas})
+            ORDER BY n.chave, c.tipo
+        ''', lote)
+        for chave, tipo, numero, emitente, cnpj, data, pdf_path, caminho, caminho_b in linhas:
+            doc = docs.get(chave)
+            if doc is None:
+                doc = docs[chave] = DocumentoExportacao(chave, tipo or '', numero or '', emitente or '',
+                                                        cnpj or '', data or '')
+                if pdf_path:
+                    doc.pdfs.append(pdf_path)
+            for xml in (caminho, caminho_b):
+                if xml and xml not in doc.xmls:
+                    doc.xmls.append(xml)
+    # Ordem final: xmls_caminhos antes de xmls_baixados; PDF ao lado de cada XML
+    for doc in docs.values():
+        for xml in doc.xmls:
+            pdf = str(caminho_solto(xml).with_suffix('.pdf'))
+            if pdf not in doc.pdfs:
+                doc.pdfs.append(pdf)
+    return docs
+
+
+def _limpar(texto: str) -> str:
+    return _INVALIDOS.sub('_', str(texto or '')).strip(' .') or '_'
+
+
+def _ano_mes(data_emissao: str) -> str:
+    data = (data_emissao or '').strip()
+    if re.match(r'^\d{4}-\d{2}', data):
+        return data[:7]
+    m = re.match(r'^\d{2}/(\d{2})/(\d{4})', data)
+    return f"{m.group(2)}-{m.group(1)}" if m else 'sem_data'
+
+
+def nome_relativo(doc: DocumentoExportacao, layout: str = 'plano', nome_personalizado: bool = False) -> str:
+    """Caminho do documento no destino, sem extensão (ex.: '2025-01/NFe/123_Empresa')."""
+    if nome_personalizado:
+        emitente = "".join(c for c in (doc.nome_emitente or 'Desconhecido')
+                           if c.isalnum() or c in (' ', '-', '_')).strip()
+        base = f"{doc.numero or 'SN'}_{emitente}"
+    else:
+        base = doc.chave
+    pasta = LAYOUTS.get(layout, "").format(
+        ano_mes=_ano_mes(doc.data_emissao),
+        cnpj_emitente=_limpar(doc.cnpj_emitente or 'sem_emitente'),
+        tipo=_limpar(doc.tipo or 'outros'),
+    )
+    return "/".join(p for p in (pasta, _limpar(base)) if p)
+
+
+class DestinoZip:
+    """Um .zip só; gravado em temporário e publicado em fechar()."""
+
+    def __init__(self, caminho: Union[str, Path]):
+        self.caminho = Path(caminho)
+        self._tmp = self.caminho.with_name(f".{self.caminho.stem}.{os.getpid()}.tmp.zip")
+        self._zip = zipfile.ZipFile(self._tmp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._nomes = set()
+
+    def existe(self, nome: str) -> bool:
+        return nome in self._nomes
+
+    def gravar(self, nome: str, dados: bytes):
+        self._nomes.add(nome)
+        compressao = zipfile.ZIP_STORED if nome.lower().endswith('.pdf') else zipfile.ZIP_DEFLATED
+        self._zip.writestr(nome, dados, compress_type=compressao)
+
+    def fechar(self, descartar: bool = False):
+        self._zip.close()
+        if descartar:
+            self._tmp.unlink(missing_ok=True)
+        else:
+            os.replace(self._tmp, self.caminho)
+
+
+class DestinoPasta:
+    """Arquivos soltos sob `pasta` (subpastas criadas conforme o layout)."""
+
+    def __init__(self, pasta: Union[str, Path]):
+        self.caminho = Path(pasta)
+        self._nomes = set()
+
+    def existe(self, nome: str) -> bool:
+        return nome in self._nomes  # arquivo de exportação anterior é sobrescrito
+
+    def gravar(self, nome: str, dados: bytes):
+        self._nomes.add(nome)
+        destino = self.caminho / nome
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        with open(destino, 'wb') as f:
+            f.write(dados)
+
+    def fechar(self, descartar: bool = False):
+        pass  # arquivos já gravados ficam (exportação parcial)
+
+
+class ExportadorLote:
+    """
+    Lê em paralelo e grava num destino (DestinoZip/DestinoPasta).
+
+    Args:
+        localizar_xml/localizar_pdf: busca lenta opcional (ex.: varredura de
+            pastas) para documento cujo caminho não está no banco — roda nos
+            leitores, nunca na thread da interface.
+    """
+
+    def __init__(self, destino, exportar_xml: bool = True, exportar_pdf: bool = True,
+                 nome_personalizado: bool = False, layout: str = 'plano',
+                 gerar_pdf_faltante: bool = True, leitores: int = LEITORES,
+                 localizar_xml: Optional[Callable[[str], Optional[Path]]] = None,
+                 localizar_pdf: Optional[Callable[[str], Optional[Path]]] = None):
+        self.destino = destino
+        self.exportar_xml = exportar_xml
+        self.exportar_pdf = exportar_pdf
+        self.nome_personalizado = nome_personalizado
+        self.layout = layout if layout in LAYOUTS else 'plano'
+        self.gerar_pdf_faltante = gerar_pdf_faltante
+        self.leitores = max(1, leitores)
+        self.localizar_xml = localizar_xml
+        self.localizar_pdf = localizar_pdf
+        self._cancelado = threading.Event()
+
+    def cancelar(self):
+        self._cancelado.set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self._cancelado.is_set()
+
+    def _primeiro(self, candidatos: Iterable[str], localizar, chave: str) -> Tuple[Optional[str], Optional[bytes]]:
+        for caminho in candidatos:
+            dados = ler_bytes(caminho)
+            if dados is not None:
+                return caminho, dados
+        if localizar:
+            try:
+                achado = localizar(chave)
+            except Exception:
+                achado = None
+            if achado:
+                dados = ler_bytes(str(achado))
+                if dados is not None:
+                    return str(achado), dados
+        return None, None
+
+    def _ler(self, doc: DocumentoExportacao) -> Dict:
+        """Roda no leitor: bytes de XML/PDF do documento."""
+        lido = {'doc': doc, 'xml': None, 'xml_caminho': None, 'pdf': None}
+        if self.exportar_xml or self.exportar_pdf:
+            lido['xml_caminho'], lido['xml'] = self._primeiro(doc.xmls, self.localizar_xml, doc.chave)
+        if self.exportar_pdf:
+            _, lido['pdf'] = self._primeiro(doc.pdfs, self.localizar_pdf, doc.chave)
+        return lido
+
+    def _nome_livre(self, nome: str, extensao: str) -> str:
+        candidato, n = f"{nome}{extensao}", 1
+        while self.destino.existe(candidato):
+            n += 1
+            candidato = f"{nome}_{n}{extensao}"
+        return candidato
+
+    def executar(self, documentos: Sequence[DocumentoExportacao],
+                 progresso: Optional[Callable[[int, int], None]] = None) -> Dict:
+        """
+        Exporta e fecha o destino (ZIP cancelado é descartado). Retorna
+        {'exportados', 'pulados', 'arquivos', 'bytes', 'erros', 'cancelado'}.
+        """
+        total = len(documentos)
+        stats = {'exportados': 0, 'pulados': 0, 'arquivos': 0, 'bytes': 0, 'erros': [], 'cancelado': False}
+        # PDFs a gerar: o XML vai para a pasta temporária assim que é lido, a
+        # lista guarda só o caminho (com 50 mil notas sem PDF, guardar os bytes
+        # seguraria todos os XMLs na memória até o fim da leitura)
+        sem_pdf: List[Tuple[DocumentoExportacao, str, Path, bool]] = []  # (doc, nome, xml temporário, já contado)
+        temporaria: Optional[tempfile.TemporaryDirectory] = None
+        feitos = 0
+
+        def gravar(nome: str, dados: bytes):
+            self.destino.gravar(nome, dados)
+            stats['arquivos'] += 1
+            stats['bytes'] += len(dados)
+
+        pendentes = iter(documentos)
+        em_voo: Dict = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.leitores, thread_name_prefix='exportacao') as pool:
+                while True:
+                    while len(em_voo) < self.leitores * JANELA_POR_LEITOR and not self.cancelado:
+                        doc = next(pendentes, None)
+                        if doc is None:
+                            break
+                        em_voo[pool.submit(self._ler, doc)] = doc
+                    if not em_voo:
+                        break
+                    prontos, _ = wait(list(em_voo), return_when=FIRST_COMPLETED)
+                    for futuro in prontos:
+                        doc = em_voo.pop(futuro)
+                        feitos += 1
+                        try:
+                            lido = futuro.result()
+                        except Exception as e:
+                            stats['erros'].append(f"{doc.chave}: {e}")
+                            continue
+                        nome = nome_relativo(doc, self.layout, self.nome_personalizado)
+                        gravou = adiado = False
+                        if self.exportar_xml:
+                            if lido['xml'] is not None:
+                                gravar(self._nome_livre(nome, '.xml'), lido['xml'])
+                                gravou = True
+                            elif doc.tipo != 'NFS-e':  # NFS-e consultada via API não tem XML
+                                stats['erros'].append(f"XML não encontrado: {doc.chave}")
+                        if self.exportar_pdf:
+                            if lido['pdf'] is not None:
+                                gravar(self._nome_livre(nome, '.pdf'), lido['pdf'])
+                                gravou = True
+                            elif lido['xml'] is not None and self.gerar_pdf_faltante:
+                                if temporaria is None:
+                                    temporaria = tempfile.TemporaryDirectory(prefix="exportacao_pdf_")
+                                xml_tmp = Path(temporaria.name) / f"{doc.chave}.xml"
+                                xml_tmp.write_bytes(lido['xml'])
+                                sem_pdf.append((doc, nome, xml_tmp, gravou))
+                                adiado = True
+                            elif doc.tipo != 'NFS-e':
+                                stats['erros'].append(f"XML não encontrado para gerar PDF: {doc.chave}")
+                        if gravou:
+                            stats['exportados'] += 1
+                        elif not adiado:  # adiado: conta depois de gerar o PDF
+                            stats['pulados'] += 1
+                        if progresso:
+                            progresso(feitos, total)
+                    if self.cancelado:
+                        for futuro in em_voo:
+                            futuro.cancel()
+                        em_voo.clear()
+                        break
+
+            if sem_pdf and not self.cancelado:
+                self._gerar_pdfs(sem_pdf, gravar, stats)
+        except BaseException:
+            self.destino.fechar(descartar=True)
+            raise
+        finally:
+            if temporaria is not None:
+                temporaria.cleanup()
+
+        stats['cancelado'] = self.cancelado
+        self.destino.fechar(descartar=self.cancelado)
+        logger.info(f"📤 [EXPORTAR] {stats['exportados']} documento(s), {stats['arquivos']} arquivo(s), "
+                    f"{stats['bytes'] / 1048576:.1f} MB em {self.destino.caminho}"
+                    f"{' (cancelada)' if stats['cancelado'] else ''}")
+        return stats
+
+    def _gerar_pdfs(self, sem_pdf, gravar, stats):
+        """PDFs que faltam: XML já na pasta temporária → pdf_lote → destino."""
+        from modules.pdf_lote import TrabalhoPDF, detectar_tipo, renderizar_lote
+
+        trabalhos, pendentes = [], {}
+        for doc, nome, xml_tmp, contado in sem_pdf:
+            tipo = detectar_tipo(xml_tmp.read_text(encoding='utf-8', errors='ignore'))
+            if not tipo:
+                stats['erros'].append(f"Falha ao gerar PDF: {doc.chave}")
+                stats['pulados'] += 0 if contado else 1
+                continue
+            trabalho = TrabalhoPDF(str(xml_tmp), str(xml_tmp.with_suffix('.pdf')), tipo, doc.chave)
+            trabalhos.append(trabalho)
+            pendentes[trabalho.out_path] = (nome, contado)
+        for resultado in renderizar_lote(trabalhos, cancelado=lambda: self.cancelado):
+            trabalho = resultado.trabalho
+            nome, contado = pendentes[trabalho.out_path]
+            if resultado.ok:
+                with open(trabalho.out_path, 'rb') as f:
+                    gravar(self._nome_livre(nome, '.pdf'), f.read())
+                stats['exportados'] += 0 if contado else 1
+            else:
+                stats['erros'].append(f"Falha ao gerar PDF: {trabalho.chave} ({resultado.erro})")
+                stats['pulados'] += 0 if contado else 1
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Fila persistente de requisições à SEFAZ que não puderam ser feitas na hora.
+
+Sem internet (ou com o certificado em cooldown de erro 656) a manifestação,
+a consulta de status e a busca por chave simplesmente falhavam, e o
+ciclo_nsu só dormia (5 s → 15 s → 60 s → 5 min) esperando a rede voltar.
+Agora o pedido vai para a tabela fila_requisicoes (migração 7) e é refeito
+sozinho quando a conectividade volta:
+
+    tipo               'manifestacao' | 'busca_chave' | 'status'
+    chave_dedup        UNIQUE — o mesmo pedido enfileirado duas vezes é um só
+    payload            JSON com os parâmetros do executor
+    prioridade         menor = antes (manifestação tem prazo legal)
+    proxima_tentativa  epoch; backoff a cada falha, cooldown 656 via Adiar
+
+ReprodutorFila.drenar() só começa se a sonda de conectividade responder;
+executa os itens vencidos em ordem de prioridade, no máximo `por_minuto`
+chamadas por certificado, e para na primeira falha de rede (offline de novo).
+O executor sinaliza:
+    - retorno normal      → item concluído (removido);
+    - Adiar(segundos)     → cooldown (656), sem contar tentativa;
+    - Rejeitada           → a SEFAZ respondeu que não; repetir não adianta (removido);
+    - outra exceção       → backoff; após MAX_TENTATIVAS o item é descartado.
+
+Uso:
+    from modules.fila_offline import ReprodutorFila, enfileirar
+
+    with sqlite3.connect(db_path) as conn:
+        enfileirar(conn, 'manifestacao', informante, chave, {'tipo_evento': '210210'})
+    ReprodutorFila(db_path, {'manifestacao': enviar}, sonda=sonda_conectividade).drenar()
+"""
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger('nfe_search')
+
+PRIORIDADES = {
+    'manifestacao': 0,
+    'busca_chave': 1,
+    'status': 2,
+}
+PRIORIDADE_PADRAO = 5
+MAX_TENTATIVAS = 8
+BACKOFF = [60, 300, 900, 3600]      # segundos, por número de falhas
+ESPERA_OFFLINE = 60                 # item interrompido por queda de rede volta em 1 min
+POR_MINUTO_PADRAO = 20              # chamadas por certificado na reprodução
+
+
+class Adiar(Exception):
+    """O item não pode ser feito agora (ex.: cooldown 656); tenta de novo em `segundos`."""
+
+    def __init__(self, segundos: float, motivo: str = ""):
+        super().__init__(motivo or f"adiado por {segundos:.0f}s")
+        self.segundos = segundos
+
+
+class Rejeitada(Exception):
+    """A SEFAZ respondeu e recusou o pedido — não adianta repetir."""
+
+
+def erro_de_rede(erro: BaseException) -> bool:
+    """Conexão recusada/timeout/DNS ou HTTP 5xx: o pedido pode ser refeito quando a rede voltar."""
+    resposta = getattr(erro, 'response', None)
+    status = getattr(resposta, 'status_code', None)
+    if status is not None:
+        return status >= 500
+    # requests.exceptions.ConnectionError/Timeout herdam de OSError (IOError)
+    return isinstance(erro, (ConnectionError, TimeoutError, OSError)) and \
+        not isinstance(erro, (FileNotFoundError, PermissionError))
+
+
+@dataclass
+class ItemFila:
+    id: int
+    tipo: str
+    informante: str
+    chave: str
+    payload: Dict = field(default_factory=dict)
+    tentativas: int = 0
+
+
+def criar_tabela(conn: sqlite3.Connection):
+    """Cria fila_requisicoes (migração)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS fila_requisicoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo TEXT NOT NULL,
+        informante TEXT NOT NULL DEFAULT '',
+        chave TEXT NOT NULL DEFAULT '',
+        chave_dedup TEXT NOT NULL UNIQUE,
+        payload TEXT,
+        prioridade INTEGER NOT NULL DEFAULT 5,
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        proxima_tentativa INTEGER NOT NULL DEFAULT 0,
+        criado_em INTEGER NOT NULL,
+        ultimo_erro TEXT
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fila_requisicoes_ordem "
+                 "ON fila_requisicoes(prioridade, proxima_tentativa, id)")
+
+
+def chave_dedup(tipo: str, informante: str, chave: str, payload: Optional[Dict] = None) -> str:
+    """Manifestação distingue o evento; os demais tipos, só (tipo, certificado, chave)."""
+    partes = [tipo, informante or '', chave or '']
+    if tipo == 'manifestacao' and payload:
+        partes.append(str(payload.get('tipo_evento', '')))
+    return ':'.join(partes)
+
+
+def enfileirar(conn: sqlite3.Connection, tipo: str, informante: str, chave: str,
+               payload: Optional[Dict] = None, prioridade: Optional[int] = None,
+               apos: float = 0, agora: Optional[float] = None) -> bool:
+    """
+    Grava o pedido (sem commit). Retorna True se é novo; se já existia, fica
+    com a maior prioridade, a tentativa mais cedo e o payload mais recente.
+    """
+    agora = int(time.time() if agora is None else agora)
+    if prioridade is None:
+        prioridade = PRIORIDADES.get(tipo, PRIORIDADE_PADRAO)
+    dedup = chave_dedup(tipo, informante, chave, payload)
+    existe = conn.execute("SELECT 1 FROM fila_requisicoes WHERE chave_dedup = ?", (dedup,)).fetchone()
+    conn.execute('''
+        INSERT INTO fila_requisicoes
+            (tipo, informante, chave, chave_dedup, payload, prioridade, proxima_tentativa, criado_em)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(chave_dedup) DO UPDATE SET
+            payload = excluded.payload,
+            prioridade = MIN(prioridade, excluded.prioridade),
+            proxima_tentativa = MIN(proxima_tentativa, excluded.proxima_tentativa)
+    ''', (tipo, informante or '', chave or '', dedup,
+          json.dumps(payload or {}, ensure_ascii=False), prioridade, agora + int(apos), agora))
+    return existe is None
+
+
+def pendentes(conn: sqlite3.Connection, limite: Optional[int] = 100,
+              agora: Optional[float] = None) -> List[ItemFila]:
+    """Itens vencidos, em ordem de prioridade e chegada."""
+    agora = int(time.time() if agora is None else agora)
+    sql = ("SELECT id, tipo, informante, chave, payload, tentativas FROM fila_requisicoes "
+           "WHERE proxima_tentativa <= ? ORDER BY prioridade, proxima_tentativa, id")
+    params = [agora]
+    if limite is not None:
+        sql += " LIMIT ?"
+        params.append(int(limite))
+    itens = []
+    for id_, tipo, informante, chave, payload, tentativas in conn.execute(sql, params):
+        try:
+            dados = json.loads(payload) if payload else {}
+        except ValueError:
+            dados = {}
+        itens.append(ItemFila(id_, tipo, informante, chave, dados, tentativas))
+    return itens
+
+
+def concluir(conn: sqlite3.Connection, item_id: int):
+    conn.execute("DELETE FROM fila_requisicoes WHERE id = ?", (item_id,))
+
+
+def adiar(conn: sqlite3.Connection, item: ItemFila, erro: object, segundos: Optional[float] = None,
+          contar: bool = True, agora: Optional[float] = None) -> bool:
+    """
+    Reagenda o item (backoff pelo número de falhas se `segundos` não vier).
+    Retorna False se esgotou as tentativas e foi descartado.
+    """
+    agora = int(time.time() if agora is None else agora)
+    tentativas = item.tentativas + (1 if contar else 0)
+    if tentativas >= MAX_TENTATIVAS:
+        concluir(conn, item.id)
+        logger.warning(f"🗑️ [FILA] {item.tipo} {item.chave or item.informante} descartado após "
+                       f"{tentativas} tentativas: {str(erro)[:120]}")
+        return False
+    if segundos is None:
+        segundos = BACKOFF[min(max(tentativas - 1, 0), len(BACKOFF) - 1)]
+    conn.execute(
+        "UPDATE fila_requisicoes SET tentativas = ?, proxima_tentativa = ?, ultimo_erro = ? WHERE id = ?",
+        (tentativas, agora + int(segundos), str(erro)[:300], item.id)
+    )
+    item.tentativas = tentativas
+    return True
+
+
+def contar(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Pedidos na fila por tipo (para a interface)."""
+    return dict(conn.execute("SELECT tipo, COUNT(*) FROM fila_requisicoes GROUP BY tipo").fetchall())
+
+
+class ReprodutorFila:
+    """Refaz os pedidos da fila quando a conectividade volta."""
+
+    def __init__(self, db_path: Union[str, Path],
+                 executores: Dict[str, Callable[[ItemFila], object]],
+                 sonda: Optional[Callable[[], bool]] = None,
+                 por_minuto: int = POR_MINUTO_PADRAO,
+                 relogio: Callable[[], float] = time.time,
+                 dormir: Callable[[float], None] = time.sleep):
+        self.db_path = str(db_path)
+        self.executores = executores
+        self.sonda = sonda
+        self.intervalo = 60.0 / max(1, por_minuto)
+        self._relogio = relogio
+        self._dormir = dormir
+        self._ultima_chamada: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _aguardar_vez(self, informante: str):
+        """Limite de chamadas por certificado (a SEFAZ conta consumo por CNPJ)."""
+        ultima = self._ultima_chamada.get(informante)
+        if ultima is not None:
+            espera = ultima + self.intervalo - self._relogio()
+            if espera > 0:
+                self._dormir(espera)
+        self._ultima_chamada[informante] = self._relogio()
+
+    def drenar(self, limite: Optional[int] = None) -> Dict[str, int]:
+        """
+        Executa os itens vencidos. Só uma drenagem por vez no processo; uma
+        segunda chamada concorrente retorna na hora com tudo zerado.
+        """
+        stats = {'executadas': 0, 'adiadas': 0, 'descartadas': 0}
+        if not self._lock.acquire(blocking=False):
+            return stats
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                itens = pendentes(conn, limite=limite, agora=self._relogio())
+                if not itens:
+                    return stats
+                if self.sonda is not None and not self.sonda():
+                    logger.info(f"📴 [FILA] {len(itens)} pedido(s) aguardando conexão com a SEFAZ")
+                    return stats
+                logger.info(f"📤 [FILA] Reenviando {len(itens)} pedido(s) feitos sem conexão")
+                bloqueados = set()  # certificados em cooldown nesta drenagem
+                for item in itens:
+                    executor = self.executores.get(item.tipo)
+                    if executor is None or item.informante in bloqueados:
+                        continue
+                    self._aguardar_vez(item.informante)
+                    try:
+                        executor(item)
+                    except Adiar as e:
+                        adiar(conn, item, e, segundos=e.segundos, contar=False, agora=self._relogio())
+                        stats['adiadas'] += 1
+                        if item.informante:
+                            bloqueados.add(item.informante)
+                    except Rejeitada as e:
+                        concluir(conn, item.id)
+                        stats['descartadas'] += 1
+                        logger.warning(f"🚫 [FILA] {item.tipo} {item.chave} recusado pela SEFAZ: {str(e)[:120]}")
+                    except Exception as e:
+                        if erro_de_rede(e):
+                            adiar(conn, item, e, segundos=ESPERA_OFFLINE, agora=self._relogio())
+                            stats['adiadas'] += 1
+                            conn.commit()
+                            logger.warning(f"📴 [FILA] Conexão caiu de novo — reprodução interrompida: {str(e)[:120]}")
+                            break
+                        if adiar(conn, item, e, agora=self._relogio()):
+                            stats['adiadas'] += 1
+                        else:
+                            stats['descartadas'] += 1
+                        logger.warning(f"⚠️ [FILA] Falha em {item.tipo} {item.chave}: {str(e)[:120]}")
+                    else:
+                        concluir(conn, item.id)
+                        stats['executadas'] += 1
+                    conn.commit()
+                logger.info(f"📊 [FILA] Reprodução: {stats}")
+                return stats
+            finally:
+                conn.close()
+        finally:
+            self._lock.release()
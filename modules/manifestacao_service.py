@@ -14,6 +14,8 @@ from pynfe.processamento.comunicacao import ComunicacaoSefaz
 from pynfe.processamento.serializacao import SerializacaoXML
 from pynfe.entidades.evento import EventoManifestacaoDest
 
+from .fila_offline import erro_de_rede
+
 logger = logging.getLogger('nfe_search')
 
 
@@ -30,6 +32,8 @@ class ManifestacaoService:
         """
         self.certificado_path = certificado_path
         self.certificado_senha = certificado_senha
+        # True quando o último envio falhou por rede/SEFAZ fora do ar (pode ir para a fila offline)
+        self.falha_de_rede = False
         
         # Verificar se certificado existe
         if not Path(certificado_path).exists():
@@ -100,6 +104,7 @@ class ManifestacaoService:
         Returns:
             Tupla (sucesso, protocolo, mensagem, xml_resposta)
         """
+        self.falha_de_rede = False
         try:
             logger.info("=" * 80)
             logger.info("MANIFESTAÇÃO COM PyNFe")
@@ -217,5 +222,6 @@ class ManifestacaoService:
             return (False, "", f"Lote processado mas sem retEvento: {x_motivo_lote}", resposta.text)
             
         except Exception as e:
+            self.falha_de_rede = erro_de_rede(e)
             logger.error(f"Erro ao enviar manifestacao: {e}", exc_info=True)
             return (False, "", f"Erro: {str(e)}", "")
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Itens (det) das NF-e/NFC-e numa tabela compacta e tipada.
+
+extrair_nfe_detalhado guarda só o primeiro CFOP e o primeiro NCM da nota;
+qualquer pergunta por item (NCMs comprados do fornecedor X no trimestre,
+IBS/CBS por item) exigia reabrir todos os XMLs. A tabela nfe_itens guarda
+uma linha por (chave, n_item) com os campos de det/prod e os valores de
+det/imposto em centavos (INTEGER), indexada por ncm, cfop e
+(emit_cnpj, dh_emi).
+
+A etapa é opcional (config CHAVE_ATIVO, ligada pelo menu "Indexar Itens
+das NF-e"):
+
+    - ligada, a ingestão (nfe_search._indexar_xml_no_banco e importação da
+      interface) grava os itens de cada NF-e salva com indexar_arquivo();
+    - IndexadorItens: varredura única das notas já gravadas sobre
+      modules/trabalho_paginado (páginas por rowid com checkpoint, pool de
+      processos); o extrator faz iterparse, descarta cada det assim que
+      termina e para no fim de <total>; ao terminar marca CHAVE_BACKFILL;
+    - consultas: resumo_por_ncm() (itens, quantidade e valores por NCM,
+      por emitente e período).
+
+Uso:
+    with sqlite3.connect(db_path) as conn:
+        if ativo(conn):
+            indexar_arquivo(conn, caminho_xml)
+        linhas = resumo_por_ncm(conn, emit_cnpj='12345678000199', inicio='2025-01-01', fim='2025-03-31')
+"""
+from __future__ import annotations
+
+import io
+import logging
+import sqlite3
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET  # type: ignore
+
+from modules.arquivo_mensal import ler_bytes
+from modules.trabalho_paginado import TrabalhoPaginado, ler_checkpoint as _ler_checkpoint, ler_config, marcado, marcar
+
+logger = logging.getLogger('nfe_search')
+
+CHAVE_ATIVO = 'nfe_itens_ativo'
+CHAVE_BACKFILL = 'nfe_itens_backfill'
+CHAVE_CHECKPOINT = 'nfe_itens_rowid'
+
+COLUNAS = (
+    'chave', 'n_item', 'emit_cnpj', 'dh_emi', 'c_prod', 'x_prod', 'ncm', 'cfop', 'u_com',
+    'q_com', 'v_un_com', 'v_prod_centavos', 'v_desc_centavos', 'v_icms_centavos',
+    'v_ipi_centavos', 'v_pis_centavos', 'v_cofins_centavos', 'v_ibs_centavos', 'v_cbs_centavos',
+)
+Item = namedtuple('Item', COLUNAS)
+
+# grupo de det/imposto → tag do valor (primeira ocorrência dentro do grupo)
+_IMPOSTOS = (
+    ('ICMS', 'vICMS'),
+    ('IPI', 'vIPI'),
+    ('PIS', 'vPIS'),
+    ('COFINS', 'vCOFINS'),
+    ('IBSCBS', 'vIBS'),     # gIBSCBS/vIBS = IBS UF + Município
+    ('IBSCBS', 'vCBS'),
+)
+
+_SQL_INSERIR = f"INSERT OR REPLACE INTO nfe_itens ({', '.join(COLUNAS)}) VALUES ({', '.join('?' * len(COLUNAS))})"
+
+_SQL_PENDENTES = '''
+    SELECT n.rowid, n.chave FROM notas_detalhadas n
+    WHERE n.rowid > ?
+      AND n.tipo IN ('NFe', 'NFCe', 'NFC-e')
+      AND COALESCE(n.xml_status, 'COMPLETO') <> 'RESUMO'
+      AND NOT EXISTS (SELECT 1 FROM nfe_itens i WHERE i.chave = n.chave)
+    ORDER BY n.rowid
+'''
+
+
+def criar_tabela(conn: sqlite3.Connection):
+    # Tabela com rowid: x_prod deixa a linha grande demais para WITHOUT ROWID
+    conn.execute('''CREATE TABLE IF NOT EXISTS nfe_itens (
+        chave TEXT NOT NULL,
+        n_item INTEGER NOT NULL,
+        emit_cnpj TEXT,
+        dh_emi TEXT,
+        c_prod TEXT,
+        x_prod TEXT,
+        ncm TEXT,
+        cfop TEXT,
+        u_com TEXT,
+        q_com REAL,
+        v_un_com REAL,
+        v_prod_centavos INTEGER,
+        v_desc_centavos INTEGER,
+        v_icms_centavos INTEGER,
+        v_ipi_centavos INTEGER,
+        v_pis_centavos INTEGER,
+        v_cofins_centavos INTEGER,
+        v_ibs_centavos INTEGER,
+        v_cbs_centavos INTEGER,
+        PRIMARY KEY (chave, n_item)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_itens_ncm ON nfe_itens(ncm)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_itens_cfop ON nfe_itens(cfop)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_itens_emit ON nfe_itens(emit_cnpj, dh_emi)")
+
+
+# ---------------------------------------------------------------------------
+# Extração
+# ---------------------------------------------------------------------------
+
+def _local(tag) -> str:
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def _filho(el, nome: str) -> str:
+    for filho in el:
+        if _local(filho.tag) == nome:
+            return (filho.text or '').strip()
+    return ''
+
+
+def _centavos(texto: str) -> Optional[int]:
+    try:
+        return int(round(float(texto) * 100)) if texto else None
+    except ValueError:
+        return None
+
+
+def _numero(texto: str) -> Optional[float]:
+    try:
+        return float(texto) if texto else None
+    except ValueError:
+        return None
+
+
+def _imposto(imposto, grupo: str, valor: str) -> Optional[int]:
+    if imposto is None:
+        return None
+    for filho in imposto:
+        if _local(filho.tag) == grupo:
+            for el in filho.iter():
+                if _local(el.tag) == valor:
+                    return _centavos((el.text or '').strip())
+    return None
+
+
+def _item(det, chave: str, emit_cnpj: str, dh_emi: str, ordem: int) -> Item:
+    prod = imposto = None
+    for filho in det:
+        nome = _local(filho.tag)
+        if nome == 'prod':
+            prod = filho
+        elif nome == 'imposto':
+            imposto = filho
+    p = {} if prod is None else {_local(f.tag): (f.text or '').strip() for f in prod}
+    try:
+        n_item = int(det.get('nItem') or ordem)
+    except ValueError:
+        n_item = ordem
+    return Item(
+        chave, n_item, emit_cnpj, dh_emi, p.get('cProd', ''), p.get('xProd', ''), p.get('NCM', ''),
+        p.get('CFOP', ''), p.get('uCom', ''), _numero(p.get('qCom')), _numero(p.get('vUnCom')),
+        _centavos(p.get('vProd')), _centavos(p.get('vDesc')),
+        *(_imposto(imposto, grupo, valor) for grupo, valor in _IMPOSTOS),
+    )
+
+
+def extrair_itens(dados: Union[bytes, str], chave: str = '') -> List[Item]:
+    """
+    Itens de uma NF-e/NFC-e (nfeProc ou NFe). A chave vem de infNFe/@Id
+    quando não informada; emitente e dhEmi vêm antes de det no documento.
+    Para no fim de <total>: transporte, pagamento e assinatura nem são lidos.
+    """
+    if isinstance(dados, str):
+        dados = dados.encode('utf-8')
+    itens: List[Item] = []
+    emit_cnpj = dh_emi = ''
+    for evento, el in ET.iterparse(io.BytesIO(dados), events=('start', 'end')):
+        tag = _local(el.tag)
+        if evento == 'start':
+            if tag == 'infNFe' and not chave:
+                chave = (el.get('Id') or '')[-44:]
+        elif tag == 'ide':
+            dh_emi = _filho(el, 'dhEmi') or _filho(el, 'dEmi')
+        elif tag == 'emit':
+            emit_cnpj = _filho(el, 'CNPJ') or _filho(el, 'CPF')
+        elif tag == 'det':
+            itens.append(_item(el, chave, emit_cnpj, dh_emi, len(itens) + 1))
+            el.clear()  # itens já lidos não ficam na memória
+        elif tag == 'total':
+            break
+    return itens if len(chave) == 44 and chave.isdigit() else []
+
+
+# ---------------------------------------------------------------------------
+# Gravação e consultas
+# ---------------------------------------------------------------------------
+
+def ativo(conn: sqlite3.Connection) -> bool:
+    return ler_config(conn, CHAVE_ATIVO) == '1'
+
+
+def ativar(conn: sqlite3.Connection, ligado: bool = True):
+    marcar(conn, CHAVE_ATIVO, '1' if ligado else '0')
+
+
+def registrar(conn: sqlite3.Connection, notas: Iterable[Tuple[str, Sequence[Item]]]) -> int:
+    """Substitui os itens de cada (chave, itens) em lote; devolve quantos itens gravou."""
+    notas = [(chave, itens) for chave, itens in notas if chave]
+    if not notas:
+        return 0
+    conn.executemany("DELETE FROM nfe_itens WHERE chave = ?", [(chave,) for chave, _ in notas])
+    linhas = [item for _, itens in notas for item in itens]
+    conn.executemany(_SQL_INSERIR, linhas)
+    return len(linhas)
+
+
+def indexar_arquivo(conn: sqlite3.Connection, caminho, chave: str = '') -> int:
+    """Lê o XML (solto ou no ZIP mensal) e grava os itens; 0 se ilegível ou sem itens."""
+    dados = ler_bytes(caminho)
+    if not dados:
+        return 0
+    try:
+        itens = extrair_itens(dados, chave)
+    except Exception as e:
+        logger.debug(f"[ITENS] {caminho}: {e}")
+        return 0
+    return registrar(conn, [(itens[0].chave, itens)]) if itens else 0
+
+
+def resumo_por_ncm(conn: sqlite3.Connection, emit_cnpj: Optional[str] = None,
+                   inicio: Optional[str] = None, fim: Optional[str] = None) -> List[Dict]:
+    """
+    Itens, quantidade e valores (centavos) por NCM; filtros opcionais por
+    emitente e período de emissão ('AAAA-MM-DD', fim inclusive).
+    """
+    filtros, params = [], []
+    if emit_cnpj:
+        filtros.append("emit_cnpj = ?")
+        params.append(emit_cnpj)
+    if inicio:
+        filtros.append("dh_emi >= ?")
+        params.append(inicio)
+    if fim:
+        filtros.append("dh_emi < date(?, '+1 day')")
+        params.append(fim)
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    cur = conn.execute(f'''
+        SELECT ncm, COUNT(*) AS itens, COUNT(DISTINCT chave) AS notas, SUM(q_com) AS quantidade,
+               SUM(v_prod_centavos) AS v_prod_centavos, SUM(v_ibs_centavos) AS v_ibs_centavos,
+               SUM(v_cbs_centavos) AS v_cbs_centavos
+        FROM nfe_itens {where}
+        GROUP BY ncm ORDER BY v_prod_centavos DESC
+    ''', params)
+    nomes = [d[0] for d in cur.description]
+    return [dict(zip(nomes, linha)) for linha in cur]
+
+
+# ---------------------------------------------------------------------------
+# Varredura única das notas já gravadas
+# ---------------------------------------------------------------------------
+
+def backfill_concluido(conn: sqlite3.Connection) -> bool:
+    return marcado(conn, CHAVE_BACKFILL)
+
+
+def ler_checkpoint(conn: sqlite3.Connection) -> int:
+    return _ler_checkpoint(conn, CHAVE_CHECKPOINT)
+
+
+def contar_pendentes(conn: sqlite3.Connection, desde_rowid: int = 0) -> int:
+    return IndexadorItens.contar_pendentes(conn, desde_rowid)
+
+
+class IndexadorItens(TrabalhoPaginado):
+    """Varredura única das NF-e já gravadas; pausar/retomar/cancelar podem vir de outra thread."""
+
+    ROTULO = '📦 [ITENS]'
+    SQL_PENDENTES = _SQL_PENDENTES
+    CHAVE_CHECKPOINT = CHAVE_CHECKPOINT
+    CHAVE_CONCLUIDO = CHAVE_BACKFILL
+    extrair = staticmethod(extrair_itens)
+
+    def estatisticas(self) -> Dict:
+        return {'notas': 0, 'itens': 0}
+
+    def gravar(self, conn: sqlite3.Connection, resultados: List[Tuple[str, List[Item]]], stats: Dict):
+        stats['itens'] += registrar(conn, resultados)
+        stats['notas'] += sum(1 for _, itens in resultados if itens)
+
+    def resumo(self, stats: Dict) -> str:
+        return f"✅ {stats['itens']} item(ns) de {stats['notas']} nota(s)"
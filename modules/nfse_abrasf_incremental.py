@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Consulta incremental de NFS-e nos WebServices municipais (ABRASF / Ginfes).
+
+O ConsultarNfse municipal só filtra por período de emissão. Consultar sempre
+os últimos 31 dias faz cada ciclo baixar, parsear e regravar as mesmas notas.
+Aqui cada (CNPJ, provedor, município) guarda um watermark de data
+(nfse_abrasf_watermark) e a próxima consulta começa nele, menos uma pequena
+sobreposição para notas emitidas com atraso (RPS convertido depois).
+
+Períodos longos — carga inicial ou certificado parado por meses — são
+quebrados em janelas menores consultadas em paralelo; o watermark só avança
+até o fim do prefixo contíguo de janelas que responderam sem erro.
+
+Notas já recebidas ficam em nfse_abrasf_vistas (município, prestador,
+número) e são descartadas antes de qualquer parse de XML ou gravação.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger('nfe_search')
+
+SOBREPOSICAO_DIAS = 2        # reconsulta os últimos dias para pegar notas atrasadas
+DIAS_CARGA_INICIAL = 90      # primeira consulta de um provedor/município
+DIAS_POR_JANELA = 15         # muitos provedores recusam períodos longos
+MAX_JANELAS_PARALELAS = 3
+
+Janela = Tuple[date, date]
+
+
+def janelas_consulta(ultima_data: Optional[date], hoje: Optional[date] = None,
+                     sobreposicao_dias: int = SOBREPOSICAO_DIAS,
+                     dias_carga_inicial: int = DIAS_CARGA_INICIAL,
+                     dias_por_janela: int = DIAS_POR_JANELA) -> List[Janela]:
+    """Períodos (inicio, fim) inclusivos a consultar, do mais antigo ao mais recente."""
+    hoje = hoje or date.today()
+    if ultima_data is None:
+        inicio = hoje - timedelta(days=dias_carga_inicial)
+    else:
+        inicio = min(ultima_data, hoje) - timedelta(days=sobreposicao_dias)
+    janelas = []
+    while inicio <= hoje:
+        fim = min(hoje, inicio + timedelta(days=dias_por_janela - 1))
+        janelas.append((inicio, fim))
+        inicio = fim + timedelta(days=1)
+    return janelas
+
+
+def ler_watermark(conn: sqlite3.Connection, cnpj: str, provedor: str,
+                  codigo_municipio: str) -> Optional[date]:
+    row = conn.execute(
+        "SELECT ultima_data FROM nfse_abrasf_watermark "
+        "WHERE cnpj = ? AND provedor = ? AND codigo_municipio = ?",
+        (cnpj, provedor, str(codigo_municipio))
+    ).fetchone()
+    if not row:
+        return None
+    try:
+        return date.fromisoformat(row[0])
+    except (TypeError, ValueError):
+        return None
+
+
+def gravar_watermark(conn: sqlite3.Connection, cnpj: str, provedor: str,
+                     codigo_municipio: str, ultima_data: date):
+    conn.execute(
+        "INSERT OR REPLACE INTO nfse_abrasf_watermark "
+        "(cnpj, provedor, codigo_municipio, ultima_data, atualizado_em) VALUES (?, ?, ?, ?, ?)",
+        (cnpj, provedor, str(codigo_municipio), ultima_data.isoformat(),
+         datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+
+
+def numeros_conhecidos(conn: sqlite3.Connection, codigo_municipio: str, cnpj_prestador: str,
+                       numeros: Iterable[str]) -> Set[str]:
+    """Subconjunto de `numeros` já recebido antes para este município/prestador."""
+    numeros = [str(n) for n in numeros if n]
+    conhecidos: Set[str] = set()
+    for i in range(0, len(numeros), 500):
+        parte = numeros[i:i + 500]
+        marcadores = ",".join("?" * len(parte))
+        conhecidos.update(r[0] for r in conn.execute(
+            f"SELECT numero FROM nfse_abrasf_vistas WHERE codigo_municipio = ? "
+            f"AND cnpj_prestador = ? AND numero IN ({marcadores})",
+            (str(codigo_municipio), cnpj_prestador, *parte)
+        ))
+    return conhecidos
+
+
+def registrar_vistas(conn: sqlite3.Connection, codigo_municipio: str, cnpj_prestador: str,
+                     numeros: Iterable[str]):
+    conn.executemany(
+        "INSERT OR IGNORE INTO nfse_abrasf_vistas (codigo_municipio, cnpj_prestador, numero) "
+        "VALUES (?, ?, ?)",
+        [(str(codigo_municipio), cnpj_prestador, str(n)) for n in numeros if n]
+    )
+
+
+def consultar_janelas(buscar: Callable[[str, str], Dict], janelas: Sequence[Janela],
+                      max_paralelas: int = MAX_JANELAS_PARALELAS) -> Tuple[List[Dict], Optional[date], List[str]]:
+    """
+    Executa `buscar(data_ini 'dd/mm/aaaa', data_fim 'dd/mm/aaaa')` para cada
+    janela (em paralelo) e junta as notas.
+
+    Returns:
+        (notas, coberto_ate, erros) — coberto_ate é o fim da última janela do
+        prefixo contíguo sem erro (None se a primeira falhou).
+    """
+    def _uma(janela: Janela) -> Dict:
+        ini, fim = janela
+        try:
+            return buscar(ini.strftime('%d/%m/%Y'), fim.strftime('%d/%m/%Y')) or {}
+        except Exception as e:
+            return {"status": "erro", "mensagem": str(e)}
+
+    if len(janelas) <= 1 or max_paralelas <= 1:
+        resultados = [_uma(j) for j in janelas]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_paralelas, len(janelas)),
+                                thread_name_prefix="abrasf") as pool:
+            resultados = list(pool.map(_uma, janelas))
+
+    notas: List[Dict] = []
+    erros: List[str] = []
+    coberto_ate: Optional[date] = None
+    contiguo = True
+    for (ini, fim), resultado in zip(janelas, resultados):
+        if resultado.get('status', 'erro') == 'erro':
+            erros.append(f"{ini:%d/%m/%Y}–{fim:%d/%m/%Y}: {resultado.get('mensagem', 'erro desconhecido')}")
+            contiguo = False
+            continue
+        notas.extend(resultado.get('notas', []) or [])
+        if contiguo:
+            coberto_ate = fim
+    return notas, coberto_ate, erros
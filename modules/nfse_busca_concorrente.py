@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Busca concorrente de NFS-e no Ambiente Nacional (ADN) com controle adaptativo
+de taxa.
+
+O endpoint GET /contribuintes/DFe/{NSU} devolve um LOTE de até 50 documentos
+com NSU maior que o informado. Percorrer um lote por vez, com pausa fixa
+entre requisições, faz um certificado com milhares de NFS-e atrasadas levar
+várias execuções para zerar a fila. Aqui mantemos uma JANELA de requisições
+em voo, cada uma começando em um ponto diferente da faixa de NSU:
+
+    watermark=1000, passo=50  →  DFe/1000, DFe/1050, DFe/1100 ...
+
+Cada resposta cobre (inicio, maior NSU do lote]. Se sobrar buraco entre o fim
+de um lote e o próximo ponto já pedido, uma nova requisição começa no fim do
+lote. A busca termina quando um ponto devolve "sem documentos" e tudo antes
+dele já foi coberto.
+
+Tamanho da janela: AIMD (aumento aditivo, redução multiplicativa).
+    - resposta OK            → janela += 1/janela  (~ +1 por "rodada")
+    - 429 (Too Many Requests) → janela /= 2 e pausa pelo Retry-After
+"Ainda não disponível" (404 / lote vazio / cStat 137) NÃO é limitação: marca
+o fim da fila. 429 nunca é confundido com NSU inexistente — o ponto volta
+para a fila e é pedido de novo depois da pausa.
+
+O watermark só avança sobre o prefixo CONTÍGUO já coberto, então interromper
+a busca no meio (erro, 656, fechamento do programa) nunca pula documentos.
+
+Uso:
+    from modules.nfse_busca_concorrente import BuscaNSUConcorrente
+
+    busca = BuscaNSUConcorrente(servico.consultar_lote_nsu,
+                                ao_receber=processar_documento,
+                                ao_avancar=lambda nsu: db.set_last_nsu_nfse(inf, f"{nsu:015d}"))
+    resultado = busca.executar(int(db.get_last_nsu_nfse(inf) or 0))
+"""
+from __future__ import annotations
+
+import bisect
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('nfe_search')
+
+# Status de uma consulta a um ponto de NSU
+DOCUMENTOS = "documentos"   # lote com um ou mais documentos
+VAZIO = "vazio"             # 404 / lote vazio / cStat 137 — ainda não há nada depois deste NSU
+LIMITADO = "limitado"       # 429 — consumo acima do permitido, repetir depois do Retry-After
+BLOQUEADO = "bloqueado"     # cStat 656 — consumo indevido, parar a busca
+
+TAMANHO_LOTE = 50           # documentos por lote no ADN
+ESPERA_PADRAO_429 = 2.0     # segundos, quando o servidor não manda Retry-After
+ESPERA_MAXIMA_429 = 120.0
+
+
+@dataclass
+class RespostaNSU:
+    """Resultado classificado de GET /contribuintes/DFe/{NSU}."""
+    status: str
+    documentos: List[Tuple[int, str, str]] = field(default_factory=list)  # (nsu, xml, tipo)
+    retry_after: Optional[float] = None
+    conteudo: object = None  # resposta bruta (dict JSON ou bytes), para quem ainda precisa dela
+
+
+@dataclass
+class ResultadoBusca:
+    watermark: int
+    documentos: int = 0
+    requisicoes: int = 0
+    limitadas: int = 0
+    chegou_ao_fim: bool = False
+    bloqueado: bool = False
+    erro: Optional[str] = None
+
+
+def interpretar_retry_after(valor, agora: Optional[datetime] = None) -> Optional[float]:
+    """Retry-After em segundos ('120') ou data HTTP ('Wed, 21 Oct 2026 07:28:00 GMT')."""
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        quando = parsedate_to_datetime(valor)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if quando.tzinfo is None:
+        quando = quando.replace(tzinfo=timezone.utc)
+    agora = agora or datetime.now(timezone.utc)
+    return max(0.0, (quando - agora).total_seconds())
+
+
+class ControleAIMD:
+    """Janela de concorrência com aumento aditivo e redução multiplicativa."""
+
+    def __init__(self, inicial: float = 2.0, minimo: float = 1.0, maximo: float = 6.0,
+                 fator_reducao: float = 0.5):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.fator_reducao = fator_reducao
+        self.janela = max(minimo, min(maximo, inicial))
+        self.pausa_ate = 0.0  # time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def limite(self) -> int:
+        return max(1, int(self.janela))
+
+    def sucesso(self):
+        with self._lock:
+            self.janela = min(self.maximo, self.janela + 1.0 / self.janela)
+
+    def limitado(self, retry_after: Optional[float], agora: float):
+        with self._lock:
+            # Vários 429 da mesma rajada contam como UM sinal de congestionamento
+            if agora >= self.pausa_ate:
+                self.janela = max(self.minimo, self.janela * self.fator_reducao)
+            espera = ESPERA_PADRAO_429 if retry_after is None else retry_after
+            self.pausa_ate = max(self.pausa_ate, agora + min(espera, ESPERA_MAXIMA_429))
+
+    def espera_restante(self, agora: float) -> float:
+        return max(0.0, self.pausa_ate - agora)
+
+
+_controles: Dict[str, ControleAIMD] = {}
+_controles_lock = threading.Lock()
+
+
+def controle_compartilhado(servico: str = "adn") -> ControleAIMD:
+    """
+    Controle AIMD único por serviço remoto no processo: a busca de NSU e o
+    download de DANFSe usam o mesmo ADN, então um 429 recebido por um pausa
+    também o outro.
+    """
+    with _controles_lock:
+        controle = _controles.get(servico)
+        if controle is None:
+            controle = _controles[servico] = ControleAIMD()
+        return controle
+
+
+class BuscaNSUConcorrente:
+    """
+    Percorre a distribuição de NFS-e a partir de um watermark mantendo até
+    `controle.limite` requisições em voo.
+
+    `consultar(nsu)` roda nas threads do pool e deve devolver RespostaNSU
+    (exceções contam como erro transitório). Os callbacks `ao_receber(nsu,
+    xml, tipo)` e `ao_avancar(watermark)` rodam na thread que chamou
+    executar() — a gravação no banco continua serial.
+    """
+
+    def __init__(self, consultar: Callable[[int], RespostaNSU],
+                 ao_receber: Optional[Callable[[int, str, str], None]] = None,
+                 ao_avancar: Optional[Callable[[int], None]] = None,
+                 controle: Optional[ControleAIMD] = None,
+                 passo: int = TAMANHO_LOTE,
+                 max_tentativas_erro: int = 3,
+                 cancelado: Optional[threading.Event] = None):
+        self.consultar = consultar
+        self.ao_receber = ao_receber
+        self.ao_avancar = ao_avancar
+        self.controle = controle or ControleAIMD()
+        self.passo = max(1, passo)
+        self.max_tentativas_erro = max_tentativas_erro
+        self.cancelado = cancelado or threading.Event()
+
+    def executar(self, watermark: int) -> ResultadoBusca:
+        resultado = ResultadoBusca(watermark=watermark)
+        fila: List[int] = [watermark]        # pontos a (re)pedir, menor primeiro
+        pedidos: List[int] = []              # todos os pontos já pedidos/enfileirados (ordenado)
+        cobertos: List[Tuple[int, int]] = [] # (inicio, fim] já recebidos
+        vistos = set()                       # NSUs entregues (lotes podem se sobrepor)
+        erros_por_ponto = {}
+        fim: Optional[int] = None            # menor ponto que devolveu VAZIO
+        proximo_especulativo = watermark + self.passo
+        parar = False
+        em_voo = {}
+
+        def _registrar_pedido(ponto):
+            i = bisect.bisect_left(pedidos, ponto)
+            if i == len(pedidos) or pedidos[i] != ponto:
+                pedidos.insert(i, ponto)
+
+        def _ha_pedido_em(inicio, fim_lote):
+            i = bisect.bisect_right(pedidos, inicio)
+            return i < len(pedidos) and pedidos[i] <= fim_lote
+
+        def _avancar_watermark():
+            novo = resultado.watermark
+            for inicio, fim_lote in sorted(cobertos):
+                if inicio > novo:
+                    break
+                novo = max(novo, fim_lote)
+            if novo > resultado.watermark:
+                resultado.watermark = novo
+                if self.ao_avancar:
+                    self.ao_avancar(novo)
+
+        _registrar_pedido(watermark)
+        with ThreadPoolExecutor(max_workers=max(1, int(self.controle.maximo)),
+                                thread_name_prefix="nfse-nsu") as pool:
+            while True:
+                if self.cancelado.is_set() and not parar:
+                    resultado.erro = resultado.erro or "cancelado"
+                    parar = True
+
+                # Despacha até encher a janela (respeitando pausa de 429)
+                agora = time.monotonic()
+                while not parar and len(em_voo) < self.controle.limite \
+                        and self.controle.espera_restante(agora) == 0:
+                    if fila:
+                        ponto = heapq.heappop(fila)
+                    elif fim is None:
+                        ponto = proximo_especulativo
+                        if ponto <= pedidos[-1]:
+                            ponto = pedidos[-1] + self.passo
+                        proximo_especulativo = ponto + self.passo
+                        _registrar_pedido(ponto)
+                    else:
+                        break
+                    if fim is not None and ponto > fim:
+                        continue
+                    resultado.requisicoes += 1
+                    em_voo[pool.submit(self.consultar, ponto)] = ponto
+
+                if not em_voo:
+                    if parar or (not fila and fim is not None):
+                        break
+                    # Nada em voo: só pode ser pausa de 429
+                    time.sleep(min(self.controle.espera_restante(time.monotonic()), 1.0) or 0.01)
+                    continue
+
+                prontos, _ = wait(list(em_voo), timeout=1.0, return_when=FIRST_COMPLETED)
+                for futuro in prontos:
+                    ponto = em_voo.pop(futuro)
+                    try:
+                        resposta = futuro.result()
+                    except Exception as e:
+                        resposta = RespostaNSU(status="erro", conteudo=e)
+
+                    fim_lote = ponto
+                    if resposta.status == DOCUMENTOS:
+                        for nsu, xml, tipo in resposta.documentos:
+                            fim_lote = max(fim_lote, nsu)
+                            if nsu in vistos:
+                                continue
+                            vistos.add(nsu)
+                            resultado.documentos += 1
+                            if self.ao_receber:
+                                self.ao_receber(nsu, xml, tipo)
+
+                    if resposta.status == DOCUMENTOS and fim_lote > ponto:
+                        self.controle.sucesso()
+                        cobertos.append((ponto, fim_lote))
+                        if not _ha_pedido_em(ponto, fim_lote) \
+                                and (fim is None or fim_lote < fim):
+                            # Buraco entre este lote e o próximo ponto pedido
+                            _registrar_pedido(fim_lote)
+                            heapq.heappush(fila, fim_lote)
+                        _avancar_watermark()
+
+                    elif resposta.status in (DOCUMENTOS, VAZIO):
+                        # Lote sem nenhum NSU depois do ponto equivale a "ainda não há nada"
+                        self.controle.sucesso()
+                        fim = ponto if fim is None else min(fim, ponto)
+                        # Pontos especulativos além do fim não precisam ser pedidos
+                        fila = [p for p in fila if p <= fim]
+                        heapq.heapify(fila)
+
+                    elif resposta.status == LIMITADO:
+                        resultado.limitadas += 1
+                        self.controle.limitado(resposta.retry_after, time.monotonic())
+                        logger.warning(f"⏳ [NFS-e] 429 no NSU {ponto}: janela → "
+                                       f"{self.controle.limite}, pausa de "
+                                       f"{self.controle.espera_restante(time.monotonic()):.1f}s")
+                        heapq.heappush(fila, ponto)
+
+                    elif resposta.status == BLOQUEADO:
+                        logger.warning(f"🔒 [NFS-e] cStat 656 no NSU {ponto} — busca interrompida")
+                        resultado.bloqueado = True
+                        parar = True
+
+                    else:
+                        erros_por_ponto[ponto] = erros_por_ponto.get(ponto, 0) + 1
+                        logger.warning(f"⚠️ [NFS-e] Erro no NSU {ponto} "
+                                       f"({erros_por_ponto[ponto]}/{self.max_tentativas_erro}): "
+                                       f"{resposta.conteudo}")
+                        if erros_por_ponto[ponto] >= self.max_tentativas_erro:
+                            resultado.erro = str(resposta.conteudo)
+                            parar = True
+                        else:
+                            heapq.heappush(fila, ponto)
+
+        # Chegou ao fim quando o prefixo contíguo alcança o ponto vazio
+        resultado.chegou_ao_fim = fim is not None and not parar and resultado.watermark >= fim
+        return resultado
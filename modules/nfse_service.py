@@ -23,6 +23,12 @@ import requests
 from requests.exceptions import RequestException
 import logging
 
+from modules.nfse_busca_concorrente import (
+    BLOQUEADO, DOCUMENTOS, LIMITADO, VAZIO, BuscaNSUConcorrente, RespostaNSU,
+    controle_compartilhado, interpretar_retry_after,
+)
+from modules.saude_endpoints import CircuitoAberto, registro_compartilhado
+
 # Configuracao de logging
 logger = logging.getLogger('nfe_search')
 
@@ -245,7 +251,30 @@ class NFSeService:
                 - None: Usa padrão (DISTRIBUICAO)
         
         Returns:
-            dict ou bytes: Resposta da API
+            dict ou bytes: Resposta da API (None = sem documentos ou rate limit)
+        
+        Para distinguir "sem documentos" de "rate limit" use consultar_lote_nsu().
+        """
+        resposta = self.consultar_lote_nsu(nsu, tipo_nsu)
+        if resposta.status == LIMITADO:
+            espera = min(resposta.retry_after or 2, 60)
+            logger.warning(f"⚠️  Rate limit atingido no NSU {nsu}, aguardando {espera:.0f}s...")
+            time.sleep(espera)
+            return None
+        return resposta.conteudo
+
+    def consultar_lote_nsu(self, nsu, tipo_nsu=None):
+        """
+        Consulta GET /contribuintes/DFe/{NSU} e classifica a resposta.
+        
+        Returns:
+            RespostaNSU com status:
+                DOCUMENTOS - lote com documentos (já decodificados em .documentos)
+                VAZIO      - 404, corpo vazio, lote vazio ou cStat 137
+                LIMITADO   - 429 (retry_after em segundos, se o servidor informou)
+                BLOQUEADO  - cStat 656
+        
+        Outros erros HTTP/rede são propagados como exceção.
         """
         endpoint = f"{self.url_base}/contribuintes/DFe/{nsu}"
         
@@ -254,35 +283,49 @@ class NFSeService:
         if tipo_nsu:
             params['tipoNSU'] = tipo_nsu
         
+        saude = registro_compartilhado()
+        if not saude.permite(self.url_base):
+            # Outro certificado já viu o ADN fora do ar: falha na hora, sem timeout
+            raise CircuitoAberto(f"ADN indisponível (nova tentativa em {saude.espera_restante(self.url_base):.0f}s)")
+        
         try:
             logger.debug(f"📡 Consultando NSU: {nsu}" + (f" (tipoNSU={tipo_nsu})" if tipo_nsu else ""))
             
-            response = self.session.get(endpoint, params=params, timeout=12)
+            inicio = time.monotonic()
+            try:
+                response = self.session.get(endpoint, params=params, timeout=12)
+            except requests.exceptions.RequestException as e:
+                saude.registrar_falha(self.url_base, e)
+                raise
+            if response.status_code >= 500:
+                saude.registrar_falha(self.url_base, f"HTTP {response.status_code}")
+            else:
+                saude.registrar_sucesso(self.url_base, time.monotonic() - inicio)
+            
+            if response.status_code == 429:
+                retry_after = interpretar_retry_after(response.headers.get('Retry-After'))
+                logger.debug(f"⏳ NSU {nsu}: 429 (Retry-After={retry_after})")
+                return RespostaNSU(LIMITADO, retry_after=retry_after)
+            if response.status_code == 404:
+                logger.info(f"📭 NSU {nsu} nao encontrado")
+                return RespostaNSU(VAZIO)
             response.raise_for_status()
             
             # Verifica se conteudo esta vazio
             if not response.content or len(response.content) == 0:
                 logger.debug(f"📭 NSU {nsu}: resposta vazia (sem documentos)")
-                return None
+                return RespostaNSU(VAZIO)
             
             # Tenta parsear como JSON
             try:
                 resultado = response.json()
                 logger.info(f"✅ NSU {nsu}: JSON recebido")
-                return resultado
-            except:
+            except ValueError:
                 # Se nao for JSON, retorna conteudo bruto
+                resultado = response.content
                 logger.info(f"✅ NSU {nsu}: XML recebido ({len(response.content)} bytes)")
-                return response.content
             
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                logger.info(f"📭 NSU {nsu} nao encontrado")
-                return None
-            elif e.response.status_code == 429:
-                logger.warning(f"⚠️  Rate limit atingido no NSU {nsu}, aguardando 2s...")
-                time.sleep(2)
-                return None
             logger.error(f"❌ Erro HTTP ao consultar NSU: {e}")
             logger.error(f"   Status: {e.response.status_code}")
             logger.error(f"   Resposta: {e.response.text}")
@@ -290,6 +333,24 @@ class NFSeService:
         except Exception as e:
             logger.error(f"❌ Erro ao consultar NSU: {e}")
             raise
+        
+        cstat, _, _ = self.extrair_cstat_nsu(resultado)
+        if cstat == '656':
+            return RespostaNSU(BLOQUEADO, conteudo=resultado)
+        if cstat == '137':
+            return RespostaNSU(VAZIO, conteudo=resultado)
+        
+        documentos = []
+        for doc_nsu, xml, tipo in self.extrair_documentos(resultado):
+            try:
+                doc_nsu = int(doc_nsu)
+            except (TypeError, ValueError):
+                doc_nsu = 0
+            if not doc_nsu:
+                # XML direto (legado) não traz NSU: pertence ao próprio ponto consultado
+                doc_nsu = int(nsu) if str(nsu).isdigit() else 0
+            documentos.append((doc_nsu, xml, tipo))
+        return RespostaNSU(DOCUMENTOS if documentos else VAZIO, documentos=documentos, conteudo=resultado)
     
     def consultar_danfse(self, chave, retry=3, numero=None, cnpj_prestador=None):
         """
@@ -610,10 +671,13 @@ def consultar_nfse_incremental(db, cert_path, senha, informante, cuf, ambiente='
     
     Estrategia:
     1. Recupera ultimo NSU processado do banco (ou NSU=0 se busca_completa=True)
-    2. Consulta documentos novos desde o ultimo NSU
-    3. Processa cada documento (valida, extrai dados)
-    4. Atualiza ultimo NSU no banco
-    5. Para quando receber 404 (fim dos documentos)
+    2. Consulta os lotes novos com uma janela de requisicoes concorrentes
+       (modules/nfse_busca_concorrente — AIMD sobre 429/Retry-After)
+    3. Coleta cada documento (valida, extrai dados)
+    4. Atualiza ultimo NSU no banco (somente o prefixo contiguo ja recebido)
+    5. Para quando a fila chega ao fim (404 / lote vazio / cStat 137)
+    
+    Não há limite de documentos por execução: toda a fila pendente é drenada.
     
     Args:
         db: Instancia do banco de dados
@@ -641,109 +705,30 @@ def consultar_nfse_incremental(db, cert_path, senha, informante, cuf, ambiente='
             logger.info(f"📍 BUSCA INCREMENTAL: Ultimo NSU processado: {ultimo_nsu:015d}")
         
         documentos_encontrados = []
-        nsu_atual = max(ultimo_nsu + 1, 1)  # Comeca do proximo (minimo 1)
-        max_tentativas_404 = 5  # Para apos 5 NSUs seguidos sem retorno
-        tentativas_404 = 0
-        max_documentos = 50  # Limite de documentos por execucao
         
-        logger.info(f"🔍 Iniciando busca a partir do NSU {nsu_atual}")
+        def _ao_receber(nsu, xml, tipo):
+            documentos_encontrados.append((nsu, xml, tipo))
+            logger.info(f"✅ NSU {nsu}: {tipo} processado")
         
-        while tentativas_404 < max_tentativas_404 and len(documentos_encontrados) < max_documentos:
-            # Delay para respeitar rate limit (1 req/segundo)
-            if nsu_atual > ultimo_nsu + 1:
-                time.sleep(1)
-            
-            # Consulta NSU atual (GET /contribuintes/DFe/{NSU})
-            resultado = servico.consultar_nsu(nsu_atual)
-            
-            if resultado is None:
-                # 404 ou 429 - NSU nao encontrado ou rate limit
-                tentativas_404 += 1
-                nsu_atual += 1
-                continue
-            
-            # Resetou contador de 404
-            tentativas_404 = 0
-            
-            # Processa resultado
-            if isinstance(resultado, dict):
-                # JSON estruturado da API
-                # Formato: {"StatusProcessamento": "...", "LoteDFe": [{NSU, ChaveAcesso, ArquivoXml, ...}], ...}
-                lote_dfe = resultado.get('LoteDFe', [])
-                
-                if not lote_dfe:
-                    logger.debug(f"📭 NSU {nsu_atual}: sem documentos no lote")
-                    tentativas_404 += 1
-                    nsu_atual += 1
-                    continue
-                
-                # Processa cada documento do lote
-                import base64
-                import gzip
-                
-                for doc in lote_dfe:
-                    doc_nsu = doc.get('NSU', nsu_atual)
-                    xml_base64 = doc.get('ArquivoXml', '')
-                    
-                    if not xml_base64:
-                        logger.warning(f"⚠️  NSU {doc_nsu}: sem ArquivoXml, pulando")
-                        continue
-                    
-                    try:
-                        # Decodifica Base64 e descomprime gzip
-                        xml_comprimido = base64.b64decode(xml_base64)
-                        xml = gzip.decompress(xml_comprimido).decode('utf-8')
-                        
-                        # Determina tipo de documento
-                        if '<Nfse' in xml or '<NFSe' in xml or '<nfse' in xml:
-                            tipo = 'NFS-e'
-                        elif '<eventoCancelamento' in xml:
-                            tipo = 'Cancelamento'
-                        else:
-                            tipo = 'Outros'
-                        
-                        # Adiciona documento encontrado
-                        documentos_encontrados.append((doc_nsu, xml, tipo))
-                        logger.info(f"✅ NSU {doc_nsu}: {tipo} processado")
-                        
-                    except Exception as e:
-                        logger.warning(f"⚠️  NSU {doc_nsu}: erro ao processar: {e}")
-                        continue
-                
-                # Reseta contador de 404 se achou documentos
-                if lote_dfe:
-                    tentativas_404 = 0
-                
-            elif isinstance(resultado, bytes):
-                # Conteudo binario (legado - possivelmente XML direto)
-                try:
-                    xml = resultado.decode('utf-8')
-                    
-                    # Determina tipo de documento
-                    if '<Nfse' in xml or '<NFSe' in xml or '<nfse' in xml:
-                        tipo = 'NFS-e'
-                    elif '<eventoCancelamento' in xml:
-                        tipo = 'Cancelamento'
-                    elif '<eventoSubstituicao' in xml:
-                        tipo = 'Substituicao'
-                    else:
-                        tipo = 'Desconhecido'
-                    
-                    documentos_encontrados.append((nsu_atual, xml, tipo))
-                    logger.info(f"✅ NSU {nsu_atual}: {tipo} processado")
-                    
-                except Exception as e:
-                    logger.warning(f"⚠️  NSU {nsu_atual}: erro ao processar bytes: {e}")
-            
-            nsu_atual += 1
+        logger.info(f"🔍 Iniciando busca a partir do NSU {ultimo_nsu}")
+        busca = BuscaNSUConcorrente(servico.consultar_lote_nsu, ao_receber=_ao_receber,
+                                    controle=controle_compartilhado())
+        resultado = busca.executar(ultimo_nsu)
+        
+        logger.info(f"📊 NFS-e: {resultado.documentos} documento(s) em {resultado.requisicoes} "
+                    f"requisição(ões), {resultado.limitadas} limitada(s) por 429"
+                    + (" — fim da fila" if resultado.chegou_ao_fim else ""))
+        if resultado.bloqueado:
+            logger.warning(f"🔒 NFS-e: cStat 656 (consumo indevido) — NSU mantido em {resultado.watermark}")
+        elif resultado.erro:
+            logger.warning(f"⚠️  NFS-e: busca interrompida ({resultado.erro}) — NSU mantido em {resultado.watermark}")
         
         # Salva ultimo NSU processado no banco
-        if documentos_encontrados:
-            # Pega o maior NSU processado
-            maior_nsu = max(doc[0] for doc in documentos_encontrados)
-            db.set_last_nsu_nfse(informante, maior_nsu)
-            logger.info(f"💾 Ultimo NSU atualizado: {maior_nsu}")
+        if resultado.watermark > ultimo_nsu:
+            db.set_last_nsu_nfse(informante, f"{resultado.watermark:015d}")
+            logger.info(f"💾 Ultimo NSU atualizado: {resultado.watermark}")
         
+        documentos_encontrados.sort(key=lambda doc: doc[0])
         return documentos_encontrados
         
     except Exception as e:
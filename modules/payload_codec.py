@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Compactação transparente das colunas de payload do notas.db.
+
+Colunas afetadas:
+    xmls_baixados.xml_completo   — XML inteiro do documento (NF-e/CT-e/evento)
+    historico_nsu.detalhes_json  — JSON de auditoria de cada consulta NSU
+
+Os valores passam a ser gravados como BLOB compactado com zlib usando um
+dicionário pré-definido (zdict) montado com o vocabulário fixo dos leiautes
+NF-e/CT-e/NFS-e (namespaces, tags, atributos de assinatura). Como os documentos
+fiscais repetem sempre as mesmas tags, o dicionário faz documentos pequenos
+(5–30 KB) compactarem quase tão bem quanto arquivos grandes.
+
+Formato do BLOB:
+    b'NZ' + versão (1 byte) + dados zlib (com zdict da versão)
+
+Leitura é retrocompatível: TEXT legado (não migrado) é devolvido como está,
+então a migração pode rodar a qualquer momento, inclusive parcialmente.
+
+Uso:
+    from modules.payload_codec import compactar, descompactar
+
+    conn.execute("UPDATE xmls_baixados SET xml_completo = ? WHERE chave = ?",
+                 (compactar(xml_txt), chave))
+    xml_txt = descompactar(row[0])
+
+Migração única + relatório de tamanho: scripts/compactar_payloads.py
+"""
+from __future__ import annotations
+
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+_MAGIC = b"NZ"
+_VERSAO_ATUAL = 1
+_NIVEL_ZLIB = 9
+
+# Colunas de payload compactadas: (tabela, coluna, chave primária)
+COLUNAS_PAYLOAD = (
+    ("xmls_baixados", "xml_completo", "chave"),
+    ("historico_nsu", "detalhes_json", "id"),
+)
+
+# ---------------------------------------------------------------------------
+# Dicionário v1 — vocabulário dos leiautes fiscais.
+# O zlib dá mais peso ao FINAL do dicionário (distâncias menores), então os
+# trechos mais frequentes ficam por último.
+# ---------------------------------------------------------------------------
+_VOCABULARIO_V1 = [
+    # JSON do histórico NSU
+    '[{"tipo": "nfe", "chave": "', '{"tipo": "evento", "chave": "', '{"tipo": "cte", "chave": "',
+    '{"tipo": "nfse", "chave": "', '", "evento": "210210"}, ', '", "nsu": "',
+    # NFS-e Nacional
+    '<NFSe xmlns="http://www.sped.fazenda.gov.br/nfse" versao="1.00">', '<infNFSe Id="NFS',
+    '<xLocEmi>', '<xLocPrestacao>', '<nNFSe>', '<cLocIncid>', '<xLocIncid>', '<xTribNac>',
+    '<xNBS>', '<verAplic>', '<ambGer>', '<tpEmis>', '<procEmi>', '<cStat>', '<dhProc>',
+    '<nDFSe>', '<DPS versao="1.00">', '<infDPS Id="DPS', '<dCompet>', '<prest>', '<toma>',
+    '<serv>', '<locPrest>', '<cLocPrestacao>', '<cServ>', '<cTribNac>', '<xDescServ>',
+    '<valores>', '<vServPrest>', '<vServ>', '<trib>', '<tribMun>', '<tribISSQN>',
+    '<tpRetISSQN>', '<totTrib>', '<vTotTrib>', '<vLiq>', '<vBC>', '<pAliqAplic>', '<vISSQN>',
+    # Eventos
+    '<procEventoNFe versao="1.00" xmlns="http://www.portalfiscal.inf.br/nfe">',
+    '<evento versao="1.00">', '<infEvento Id="ID', '<cOrgao>', '<tpAmb>1</tpAmb>',
+    '<chNFe>', '</chNFe>', '<dhEvento>', '<tpEvento>', '<nSeqEvento>1</nSeqEvento>',
+    '<verEvento>1.00</verEvento>', '<detEvento versao="1.00">', '<descEvento>',
+    'Cancelamento</descEvento>', 'Ciencia da Operacao</descEvento>', '<xJust>', '<xCorrecao>',
+    '<retEvento versao="1.00">', '<dhRegEvento>', '<nProt>',
+    # CT-e
+    '<cteProc xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">',
+    '<CTe xmlns="http://www.portalfiscal.inf.br/cte">', '<infCte Id="CTe', '" versao="4.00">',
+    '<cCT>', '<nCT>', '<modal>01</modal>', '<tpServ>', '<tpCTe>', '<cMunIni>', '<xMunIni>',
+    '<UFIni>', '<cMunFim>', '<xMunFim>', '<UFFim>', '<retira>', '<indIEToma>', '<toma3>',
+    '<toma>', '<rem>', '<exped>', '<receb>', '<enderReme>', '<enderDest>', '<vPrest>',
+    '<vTPrest>', '<vRec>', '<Comp>', '<xNome>', '<vComp>', '<imp>', '<ICMS00>', '<ICMS45>',
+    '<pICMS>', '<infCTeNorm>', '<infCarga>', '<vCarga>', '<proPred>', '<infQ>', '<cUnid>',
+    '<tpMed>', '<qCarga>', '<infDoc>', '<infNFe><chave>', '</chave></infNFe>', '<infModal versaoModal="4.00">',
+    '<rodo>', '<RNTRC>', '<protCTe versao="4.00">', '<infProt>', '<chCTe>', '<digVal>',
+    # Assinatura XMLDSig
+    '<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo>',
+    '<CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>',
+    '<SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>',
+    '<Reference URI="#', '"><Transforms>',
+    '<Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>',
+    '<Transform Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/></Transforms>',
+    '<DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/><DigestValue>',
+    '</DigestValue></Reference></SignedInfo><SignatureValue>',
+    '</SignatureValue><KeyInfo><X509Data><X509Certificate>',
+    '</X509Certificate></X509Data></KeyInfo></Signature>',
+    # NF-e — totais, transporte, pagamento, protocolo
+    '<total><ICMSTot><vBC>', '</vBC><vICMS>', '</vICMS><vICMSDeson>', '</vICMSDeson><vFCP>',
+    '</vFCP><vBCST>', '</vBCST><vST>', '</vST><vFCPST>', '</vFCPST><vFCPSTRet>',
+    '</vFCPSTRet><vProd>', '</vProd><vFrete>', '</vFrete><vSeg>', '</vSeg><vDesc>',
+    '</vDesc><vII>', '</vII><vIPI>', '</vIPI><vIPIDevol>', '</vIPIDevol><vPIS>',
+    '</vPIS><vCOFINS>', '</vCOFINS><vOutro>', '</vOutro><vNF>', '</vNF><vTotTrib>',
+    '</ICMSTot>', '<IBSCBSTot><vBCIBSCBS>', '<gIBS><gIBSUF><vDif>', '<vDevTrib>', '<vIBSUF>',
+    '<gIBSMun>', '<vIBSMun>', '<vIBS>', '<gCBS>', '<vCBS>', '</IBSCBSTot></total>',
+    '<transp><modFrete>', '</modFrete>', '<transporta>', '<vol><qVol>', '<esp>', '<pesoL>',
+    '<pesoB>', '<cobr><fat><nFat>', '<vOrig>', '<vLiq>', '<dup><nDup>', '<dVenc>', '<vDup>',
+    '<pag><detPag><indPag>', '<tPag>', '</tPag><vPag>', '</vPag></detPag></pag>',
+    '<infAdic><infCpl>', '</infCpl></infAdic>', '<infRespTec>', '<xContato>', '<fone>',
+    '<protNFe versao="4.00"><infProt>', '<tpAmb>1</tpAmb><verAplic>', '</verAplic><chNFe>',
+    '</chNFe><dhRecbto>', '</dhRecbto><nProt>', '</nProt><digVal>', '</digVal><cStat>100</cStat>',
+    '<xMotivo>Autorizado o uso da NF-e</xMotivo></infProt></protNFe></nfeProc>',
+    # NF-e — itens
+    '<det nItem="', '"><prod><cProd>', '</cProd><cEAN>SEM GTIN</cEAN><xProd>', '</xProd><NCM>',
+    '</NCM><CEST>', '</NCM><CFOP>', '</CFOP><uCom>', '</uCom><qCom>', '</qCom><vUnCom>',
+    '</vUnCom><vProd>', '</vProd><cEANTrib>SEM GTIN</cEANTrib><uTrib>', '</uTrib><qTrib>',
+    '</qTrib><vUnTrib>', '</vUnTrib><indTot>1</indTot>', '<xPed>', '<nItemPed>', '</prod>',
+    '<imposto><vTotTrib>', '</vTotTrib><ICMS>', '<ICMS00><orig>', '<ICMS20><orig>',
+    '<ICMS60><orig>', '<ICMSSN101><orig>', '<ICMSSN102><orig>', '</orig><CST>', '</orig><CSOSN>',
+    '</CST><modBC>', '</modBC><vBC>', '</vBC><pICMS>', '</pICMS><vICMS>', '</vICMS></ICMS00></ICMS>',
+    '<IPI><cEnq>999</cEnq><IPITrib><CST>', '<IPINT><CST>', '</CST><vBC>', '</vBC><pIPI>',
+    '</pIPI><vIPI>', '<PIS><PISAliq><CST>', '<PISNT><CST>', '</vBC><pPIS>', '</pPIS><vPIS>',
+    '</vPIS></PISAliq></PIS>', '<COFINS><COFINSAliq><CST>', '<COFINSNT><CST>', '</vBC><pCOFINS>',
+    '</pCOFINS><vCOFINS>', '</vCOFINS></COFINSAliq></COFINS>', '<IBSCBS><CST>', '<cClassTrib>',
+    '<gIBSCBS><vBC>', '<pIBSUF>', '<pIBSMun>', '<pCBS>', '</imposto></det>',
+    # NF-e — cabeçalho, emitente, destinatário
+    '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">',
+    '<NFe xmlns="http://www.portalfiscal.inf.br/nfe"><infNFe versao="4.00" Id="NFe',
+    '"><ide><cUF>', '</cUF><cNF>', '</cNF><natOp>', '</natOp><mod>55</mod><serie>',
+    '</serie><nNF>', '</nNF><dhEmi>', '</dhEmi><dhSaiEnt>', '</dhSaiEnt><tpNF>1</tpNF><idDest>',
+    '</idDest><cMunFG>', '</cMunFG><tpImp>1</tpImp><tpEmis>1</tpEmis><cDV>', '</cDV><tpAmb>1</tpAmb>',
+    '<finNFe>1</finNFe><indFinal>', '</indFinal><indPres>', '</indPres><procEmi>0</procEmi><verProc>',
+    '</verProc></ide>', '<emit><CNPJ>', '</CNPJ><xNome>', '</xNome><xFant>', '</xFant><enderEmit>',
+    '<dest><CNPJ>', '<dest><CPF>', '</xNome><enderDest>', '<xLgr>', '</xLgr><nro>',
+    '</nro><xCpl>', '</nro><xBairro>', '</xBairro><cMun>', '</cMun><xMun>', '</xMun><UF>',
+    '</UF><CEP>', '</CEP><cPais>1058</cPais><xPais>BRASIL</xPais><fone>', '</fone></enderEmit><IE>',
+    '</fone></enderDest><indIEDest>', '</indIEDest><IE>', '</IE><CRT>', '</CRT></emit>',
+    '</IE><email>', '</email></dest>', '</IE></dest>', '-03:00</dhEmi>', '-03:00',
+    'http://www.portalfiscal.inf.br/nfe', '<?xml version="1.0" encoding="UTF-8"?>',
+]
+
+_ZDICT_POR_VERSAO: Dict[int, bytes] = {
+    1: "".join(_VOCABULARIO_V1).encode("utf-8")[-32768:],
+}
+
+
+def _zdict(versao: int) -> bytes:
+    try:
+        return _ZDICT_POR_VERSAO[versao]
+    except KeyError:
+        raise ValueError(f"Versão de dicionário de payload desconhecida: {versao}")
+
+
+def is_compactado(valor) -> bool:
+    """True se o valor já está no formato BLOB compactado deste módulo."""
+    return isinstance(valor, (bytes, bytearray, memoryview)) and bytes(valor[:2]) == _MAGIC
+
+
+def compactar(texto: Union[str, bytes, None]) -> Optional[bytes]:
+    """
+    Compacta texto (XML/JSON) para o formato BLOB. None/'' viram None.
+    Valores já compactados são devolvidos sem alteração (idempotente).
+    """
+    if texto is None or texto == "" or texto == b"":
+        return None
+    if is_compactado(texto):
+        return bytes(texto)
+    dados = texto.encode("utf-8") if isinstance(texto, str) else bytes(texto)
+    comp = zlib.compressobj(_NIVEL_ZLIB, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY,
+                            _zdict(_VERSAO_ATUAL))
+    return _MAGIC + bytes([_VERSAO_ATUAL]) + comp.compress(dados) + comp.flush()
+
+
+def descompactar(valor) -> Optional[str]:
+    """
+    Acessor transparente: devolve o texto original de uma coluna de payload,
+    seja ela BLOB compactado, TEXT legado ou bytes UTF-8 sem compactação.
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, str):
+        return valor
+    dados = bytes(valor)
+    if not is_compactado(dados):
+        return dados.decode("utf-8", errors="ignore")
+    versao = dados[2]
+    dec = zlib.decompressobj(zlib.MAX_WBITS, _zdict(versao))
+    return (dec.decompress(dados[3:]) + dec.flush()).decode("utf-8", errors="ignore")
+
+
+def _tabela_tem_coluna(conn: sqlite3.Connection, tabela: str, coluna: str) -> bool:
+    return any(row[1] == coluna for row in conn.execute(f"PRAGMA table_info({tabela})"))
+
+
+def relatorio_tamanho(db_path: Union[str, Path]) -> Dict[str, Dict[str, int]]:
+    """
+    Relatório de ocupação das colunas de payload.
+
+    Returns:
+        {'tabela.coluna': {'linhas_texto', 'linhas_blob', 'bytes_texto', 'bytes_blob'}}
+        mais 'arquivo_bytes' com o tamanho atual do notas.db.
+    """
+    relatorio: Dict[str, Dict[str, int]] = {}
+    with sqlite3.connect(str(db_path)) as conn:
+        for tabela, coluna, _pk in COLUNAS_PAYLOAD:
+            if not _tabela_tem_coluna(conn, tabela, coluna):
+                continue
+            stats = {"linhas_texto": 0, "linhas_blob": 0, "bytes_texto": 0, "bytes_blob": 0}
+            for tipo, linhas, total in conn.execute(
+                f"SELECT typeof({coluna}), COUNT(*), COALESCE(SUM(length(CAST({coluna} AS BLOB))), 0) "
+                f"FROM {tabela} WHERE {coluna} IS NOT NULL GROUP BY typeof({coluna})"
+            ):
+                if tipo == "blob":
+                    stats["linhas_blob"] += linhas
+                    stats["bytes_blob"] += total
+                else:
+                    stats["linhas_texto"] += linhas
+                    stats["bytes_texto"] += total
+            relatorio[f"{tabela}.{coluna}"] = stats
+    relatorio["arquivo"] = {"bytes": Path(db_path).stat().st_size if Path(db_path).exists() else 0}
+    return relatorio
+
+
+def migrar_payloads(db_path: Union[str, Path], lote: int = 500, vacuum: bool = False) -> Dict[str, int]:
+    """
+    Migração única: compacta todo payload TEXT legado para BLOB.
+
+    Processa em lotes (commit a cada `lote` linhas) para não segurar o banco
+    bloqueado por muito tempo. Pode ser interrompida e reexecutada — linhas
+    já compactadas são ignoradas.
+
+    Returns:
+        {'tabela.coluna': linhas_convertidas, ..., 'bytes_antes': n, 'bytes_depois': n}
+    """
+    resultado: Dict[str, int] = {"bytes_antes": 0, "bytes_depois": 0}
+    with sqlite3.connect(str(db_path), timeout=30) as conn:
+        for tabela, coluna, pk in COLUNAS_PAYLOAD:
+            if not _tabela_tem_coluna(conn, tabela, coluna):
+                continue
+            convertidas = 0
+            while True:
+                rows = conn.execute(
+                    f"SELECT {pk}, {coluna} FROM {tabela} "
+                    f"WHERE typeof({coluna}) = 'text' LIMIT ?", (lote,)
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for chave, texto in rows:
+                    blob = compactar(texto)
+                    resultado["bytes_antes"] += len(texto.encode("utf-8"))
+                    resultado["bytes_depois"] += len(blob) if blob else 0
+                    updates.append((blob, chave))
+                conn.executemany(f"UPDATE {tabela} SET {coluna} = ? WHERE {pk} = ?", updates)
+                conn.commit()
+                convertidas += len(updates)
+            resultado[f"{tabela}.{coluna}"] = convertidas
+    if vacuum:
+        conn = sqlite3.connect(str(db_path))
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    return resultado
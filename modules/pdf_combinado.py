@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Um único PDF com os DANFE/DACTE das notas selecionadas (para imprimir).
+
+Imprimir 300 notas significava abrir 300 PDFs. pdf_unico():
+
+    1. gera em paralelo (modules/pdf_lote) os PDFs que ainda não existem;
+    2. concatena na ordem da seleção com EscritorPDFIncremental, que copia
+       os objetos de cada PDF de origem direto para o arquivo de saída
+       (renumerados) e descarta o leitor — só um documento de origem fica
+       na memória por vez, com 300 ou 8.000 notas;
+    3. cria um marcador por documento (número/emitente/chave) apontando para
+       a primeira página dele;
+    4. grava num temporário e troca com os.replace no final — cancelado,
+       o temporário é descartado (um PDF pela metade nunca vira o destino).
+
+Uso:
+    docs = [DocumentoPDF(chave, titulo, pdf_path, xml_path, 'NFe'), ...]
+    stats = pdf_unico(docs, "impressao.pdf")
+"""
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger('nfe_search')
+
+# Ids fixos no arquivo de saída
+_ID_CATALOGO = 1
+_ID_PAGINAS = 2
+_ID_MARCADORES = 3
+
+
+@dataclass
+class DocumentoPDF:
+    chave: str
+    titulo: str
+    pdf_path: str = ""        # PDF existente (ou onde gerar; vazio = ao lado do XML)
+    xml_path: str = ""
+    tipo: str = "NFe"
+
+
+class EscritorPDFIncremental:
+    """
+    Escreve um PDF página a página: cada documento acrescentado tem seus
+    objetos copiados para o arquivo na hora; no fechamento entram a árvore
+    de páginas, os marcadores, o catálogo e a tabela xref.
+    """
+
+    def __init__(self, caminho: Union[str, Path]):
+        self._f = open(caminho, 'wb')
+        self._f.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        self._offsets: Dict[int, int] = {}
+        self._proximo = _ID_MARCADORES + 1
+        self._paginas: List[int] = []
+        self._marcadores: List[Tuple[str, int]] = []  # (título, id da primeira página)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        if tipo is None:
+            self.fechar()
+        else:
+            self._f.close()
+
+    @property
+    def paginas(self) -> int:
+        return len(self._paginas)
+
+    def _novo_id(self) -> int:
+        idnum = self._proximo
+        self._proximo += 1
+        return idnum
+
+    def _escrever(self, idnum: int, obj):
+        self._offsets[idnum] = self._f.tell()
+        self._f.write(b'%d 0 obj\n' % idnum)
+        obj.write_to_stream(self._f, None)
+        self._f.write(b'\nendobj\n')
+
+    def acrescentar(self, caminho_pdf: Union[str, Path], titulo: Optional[str] = None) -> int:
+        """Copia as páginas de `caminho_pdf`; retorna quantas entraram. Falha não deixa lixo no arquivo."""
+        from PyPDF2 import PdfReader
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject
+
+        leitor = PdfReader(str(caminho_pdf))
+        if leitor.is_encrypted:
+            leitor.decrypt('')
+        paginas = list(leitor.pages)  # achata a árvore: Resources/MediaBox herdados vão para a página
+        if not paginas:
+            return 0
+
+        inicio, id_inicio, n_paginas = self._f.tell(), self._proximo, len(self._paginas)
+        raiz = IndirectObject(_ID_PAGINAS, 0, None)
+        mapa: Dict[Tuple[int, int], int] = {}
+        fila: List[Tuple[int, IndirectObject]] = []
+
+        def referencia(ind):
+            chave = (ind.idnum, ind.generation)
+            if chave not in mapa:
+                mapa[chave] = self._novo_id()
+                fila.append((mapa[chave], ind))
+            return IndirectObject(mapa[chave], 0, None)
+
+        def converter(obj):
+            # Referências do documento de origem viram ids do arquivo de saída (in place)
+            if isinstance(obj, IndirectObject):
+                return obj if obj.pdf is None else referencia(obj)
+            if isinstance(obj, DictionaryObject):
+                for k, v in list(dict.items(obj)):
+                    dict.__setitem__(obj, k, converter(v))
+            elif isinstance(obj, ArrayObject):
+                for i in range(len(obj)):
+                    list.__setitem__(obj, i, converter(list.__getitem__(obj, i)))
+            return obj
+
+        try:
+            for pagina in paginas:
+                dict.__setitem__(pagina, NameObject('/Parent'), raiz)
+                self._paginas.append(referencia(pagina.indirect_reference).idnum)
+            while fila:
+                idnum, ind = fila.pop()
+                obj = ind.get_object()
+                self._escrever(idnum, NullObject() if obj is None else converter(obj))
+        except Exception:
+            self._f.seek(inicio)
+            self._f.truncate()
+            self._offsets = {k: v for k, v in self._offsets.items() if k < id_inicio}
+            self._proximo = id_inicio
+            del self._paginas[n_paginas:]
+            raise
+
+        if titulo:
+            self._marcadores.append((titulo, self._paginas[n_paginas]))
+        return len(paginas)
+
+    def fechar(self):
+        from PyPDF2.generic import (
+            ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject,
+            create_string_object,
+        )
+
+        def ref(idnum):
+            return IndirectObject(idnum, 0, None)
+
+        ids_marcadores = [self._novo_id() for _ in self._marcadores]
+        for i, ((titulo, pagina), idnum) in enumerate(zip(self._marcadores, ids_marcadores)):
+            item = DictionaryObject({
+                NameObject('/Title'): create_string_object(titulo),
+                NameObject('/Parent'): ref(_ID_MARCADORES),
+                NameObject('/Dest'): ArrayObject([ref(pagina), NameObject('/Fit')]),
+            })
+            if i > 0:
+                item[NameObject('/Prev')] = ref(ids_marcadores[i - 1])
+            if i + 1 < len(ids_marcadores):
+                item[NameObject('/Next')] = ref(ids_marcadores[i + 1])
+            self._escrever(idnum, item)
+
+        marcadores = DictionaryObject({NameObject('/Type'): NameObject('/Outlines'),
+                                       NameObject('/Count'): NumberObject(len(ids_marcadores))})
+        if ids_marcadores:
+            marcadores[NameObject('/First')] = ref(ids_marcadores[0])
+            marcadores[NameObject('/Last')] = ref(ids_marcadores[-1])
+        self._escrever(_ID_MARCADORES, marcadores)
+
+        self._escrever(_ID_PAGINAS, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(ref(i) for i in self._paginas),
+            NameObject('/Count'): NumberObject(len(self._paginas)),
+        }))
+        catalogo = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): ref(_ID_PAGINAS),
+            NameObject('/Outlines'): ref(_ID_MARCADORES),
+        })
+        if ids_marcadores:
+            catalogo[NameObject('/PageMode')] = NameObject('/UseOutlines')
+        self._escrever(_ID_CATALOGO, catalogo)
+
+        inicio_xref = self._f.tell()
+        self._f.write(b'xref\n0 %d\n' % self._proximo)
+        self._f.write(b'0000000000 65535 f \n')
+        for idnum in range(1, self._proximo):
+            offset = self._offsets.get(idnum)
+            self._f.write(b'%010d 00000 n \n' % offset if offset is not None else b'0000000000 65535 f \n')
+        self._f.write(b'trailer\n')
+        DictionaryObject({NameObject('/Size'): NumberObject(self._proximo),
+                          NameObject('/Root'): ref(_ID_CATALOGO)}).write_to_stream(self._f, None)
+        self._f.write(b'\nstartxref\n%d\n%%%%EOF\n' % inicio_xref)
+        self._f.close()
+
+
+def combinar_pdfs(itens: Iterable[Tuple[str, str]], destino: Union[str, Path],
+                  progresso: Optional[Callable[[int], None]] = None,
+                  cancelado: Optional[Callable[[], bool]] = None) -> Dict:
+    """
+    Concatena (pdf, título) em `destino`, na ordem. PDF ilegível é pulado e
+    listado em 'falhas'. Cancelado, `destino` não é criado nem substituído.
+    Retorna {'documentos', 'paginas', 'falhas', 'cancelado'}.
+    """
+    destino = Path(destino)
+    tmp = destino.with_name(f".{destino.stem}.{os.getpid()}.tmp.pdf")
+    cancelado = cancelado or (lambda: False)
+    stats = {'documentos': 0, 'paginas': 0, 'falhas': [], 'cancelado': False}
+    try:
+        with EscritorPDFIncremental(tmp) as escritor:
+            for n, (caminho, titulo) in enumerate(itens, 1):
+                if cancelado():
+                    stats['cancelado'] = True
+                    break
+                try:
+                    if escritor.acrescentar(caminho, titulo):
+                        stats['documentos'] += 1
+                except Exception as e:
+                    logger.warning(f"⚠️ [PDF-ÚNICO] {Path(caminho).name} ignorado: {e}")
+                    stats['falhas'].append((str(caminho), f"{type(e).__name__}: {e}"))
+                if progresso:
+                    progresso(n)
+            stats['paginas'] = escritor.paginas
+        if stats['paginas'] and not stats['cancelado']:
+            os.replace(tmp, destino)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return stats
+
+
+def pdf_unico(documentos: Sequence[DocumentoPDF], destino: Union[str, Path],
+              processos: Optional[int] = None,
+              progresso: Optional[Callable[[str, int, int], None]] = None,
+              cancelado: Optional[Callable[[], bool]] = None) -> Dict:
+    """
+    Gera os PDFs que faltam (em paralelo, a partir do XML) e junta todos em
+    `destino`. progresso(etapa, feitos, total) com etapa 'gerando'/'juntando'.
+
+    Returns:
+        stats de combinar_pdfs + 'gerados' [(chave, pdf, pdf_tipo)] e
+        'sem_pdf' [chave] (sem PDF e sem XML para gerar). Com 'cancelado'
+        verdadeiro nada foi gravado em `destino`.
+    """
+    from modules.pdf_lote import TrabalhoPDF, renderizar_lote
+
+    progresso = progresso or (lambda etapa, feitos, total: None)
+    faltando = {}
+    for doc in documentos:
+        if doc.pdf_path and Path(doc.pdf_path).exists():
+            continue
+        if doc.xml_path and Path(doc.xml_path).exists():
+            faltando[doc.xml_path] = doc
+
+    gerados = []
+    if faltando:
+        trabalhos = [TrabalhoPDF(xml, doc.pdf_path or str(Path(xml).with_suffix('.pdf')), doc.tipo, doc.chave)
+                     for xml, doc in faltando.items()]
+        for n, resultado in enumerate(renderizar_lote(trabalhos, processos=processos, cancelado=cancelado), 1):
+            if resultado.ok:
+                doc = faltando[resultado.trabalho.xml_path]
+                doc.pdf_path = resultado.trabalho.out_path
+                gerados.append((doc.chave, doc.pdf_path, resultado.pdf_tipo))
+            progresso('gerando', n, len(trabalhos))
+
+    com_pdf = [d for d in documentos if d.pdf_path and Path(d.pdf_path).exists()]
+    stats = combinar_pdfs(((d.pdf_path, d.titulo) for d in com_pdf), destino,
+                          progresso=lambda n: progresso('juntando', n, len(com_pdf)),
+                          cancelado=cancelado)
+    stats['cancelado'] = stats['cancelado'] or bool(cancelado and cancelado())
+    stats['gerados'] = gerados
+    stats['sem_pdf'] = [d.chave for d in documentos if d not in com_pdf]
+    if stats['cancelado']:
+        logger.info(f"🖨️ [PDF-ÚNICO] Cancelado: {destino} não foi gravado ({len(gerados)} PDF(s) gerado(s))")
+        return stats
+    logger.info(f"🖨️ [PDF-ÚNICO] {stats['documentos']} documento(s), {stats['paginas']} página(s) "
+                f"em {destino} ({len(gerados)} PDF(s) gerado(s), {len(stats['sem_pdf'])} sem PDF)")
+    return stats
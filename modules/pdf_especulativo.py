@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Pré-geração especulativa de DANFE/DACTE em segundo plano.
+
+Duplo clique numa nota sem PDF passa por _process_pdf_async: resolve o XML,
+sobe o sandbox e renderiza na hora — o usuário espera alguns segundos. O
+pré-renderizador adianta esse trabalho para as notas que ele provavelmente
+vai abrir:
+
+    - linhas visíveis na grade (visiveis(): a rolagem substitui a fila
+      anterior — só interessa o que está na tela agora);
+    - notas que chegaram no último ciclo de busca (recentes()).
+
+Regras:
+    - um único processo de renderização com prioridade ociosa (o gerador é
+      CPU; rodando em processo separado não disputa o GIL da interface) e
+      no máximo um documento em voo;
+    - cede a vez ao pedido interativo: enquanto houver um `interativo()`
+      aberto, nada novo é enviado; se o PDF pedido já está sendo gerado
+      aqui, aguardar(chave) devolve o arquivo assim que ficar pronto;
+    - orçamento de disco: cada PDF gerado por aqui fica registrado na
+      tabela pdf_especulativo; o total é conferido com o disco
+      (bytes_em_disco) na primeira geração e antes de desligar pelo
+      orçamento — PDF apagado deixa de contar. A geração para ao atingir o
+      orçamento ou quando o disco fica abaixo da reserva livre;
+    - só NF-e/NFC-e/CT-e completas — NFS-e tem o DANFSe oficial baixado por
+      modules/danfse_prefetch; eventos e resumos não têm PDF.
+
+O PDF vai para o mesmo lugar da geração sob demanda (ao lado do XML) e o
+caminho é registrado em notas_detalhadas.pdf_path — a etapa 0 do duplo
+clique abre o arquivo direto.
+
+Uso:
+    pre = obter_prerenderizador(db)
+    pre.visiveis(chaves_na_tela)
+    with pre.interativo():
+        caminho = pre.aguardar(chave, timeout=30)
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from modules.arquivo_mensal import caminho_solto
+from modules.exportacao_lote import localizar_em_lote
+from modules.pdf_lote import ResultadoPDF, TrabalhoPDF, renderizar
+
+logger = logging.getLogger('nfe_search')
+
+PRIORIDADE_VISIVEL = 0
+PRIORIDADE_RECENTE = 1
+
+MAX_FILA = 500
+ORCAMENTO_PADRAO_MB = 2048
+RESERVA_LIVRE_MB = 1024
+CHAVE_ORCAMENTO = 'pdf_especulativo_orcamento_mb'
+
+_TIPOS = {'NFE': 'NFe', 'NFCE': 'NFCe', 'CTE': 'CTe'}
+_SEM_PDF = ('EVENTO', 'RESUMO', 'INDISPONIVEL')
+
+
+def _prioridade_ociosa():
+    """Inicializador do processo de renderização: prioridade mínima do SO."""
+    try:
+        import psutil
+        psutil.Process().nice(psutil.IDLE_PRIORITY_CLASS if sys.platform == 'win32' else 19)
+    except Exception:
+        try:
+            os.nice(19)
+        except (AttributeError, OSError):
+            pass
+
+
+def criar_tabela(conn: sqlite3.Connection):
+    """Cria a tabela pdf_especulativo (migração) e descarta o contador antigo, que só crescia."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS pdf_especulativo (
+        chave TEXT PRIMARY KEY,
+        caminho TEXT NOT NULL,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        gerado_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+    ) WITHOUT ROWID''')
+    conn.execute("DELETE FROM config WHERE chave = 'pdf_especulativo_bytes'")
+
+
+def bytes_em_disco(conn: sqlite3.Connection) -> int:
+    """Confere o registro com o disco: tira os PDFs apagados, corrige tamanhos e devolve o total."""
+    total, sumiram, mudaram = 0, [], []
+    for chave, caminho, registrado in conn.execute("SELECT chave, caminho, bytes FROM pdf_especulativo").fetchall():
+        try:
+            tamanho = os.stat(caminho).st_size
+        except OSError:
+            sumiram.append((chave,))
+            continue
+        if tamanho != registrado:
+            mudaram.append((tamanho, chave))
+        total += tamanho
+    if sumiram:
+        conn.executemany("DELETE FROM pdf_especulativo WHERE chave = ?", sumiram)
+    if mudaram:
+        conn.executemany("UPDATE pdf_especulativo SET bytes = ? WHERE chave = ?", mudaram)
+    conn.commit()
+    return total
+
+
+class PreRenderizadorPDF:
+    """Fila por prioridade + uma thread que alimenta um processo ocioso."""
+
+    def __init__(self, db, orcamento_mb: Optional[int] = None, reserva_livre_mb: int = RESERVA_LIVRE_MB,
+                 usar_processo: bool = True):
+        self.db = db
+        if orcamento_mb is None:
+            try:
+                orcamento_mb = int(db.get_config(CHAVE_ORCAMENTO, ORCAMENTO_PADRAO_MB))
+            except (TypeError, ValueError):
+                orcamento_mb = ORCAMENTO_PADRAO_MB
+        self.orcamento = orcamento_mb * 1024 * 1024
+        self.reserva_livre = reserva_livre_mb * 1024 * 1024
+        self.usar_processo = usar_processo
+        self._cond = threading.Condition()
+        self._fila = []                       # heap (prioridade, ordem, chave, geração)
+        self._ordem = itertools.count()
+        self._geracao_visivel = 0
+        self._na_fila: Dict[str, int] = {}    # chave → prioridade na fila
+        self._em_voo: Optional[str] = None
+        self._prontos: Dict[str, str] = {}    # chave → PDF gerado nesta sessão
+        self._descartados = set()             # sem XML/PDF possível — não tenta de novo
+        self._interativos = 0
+        self._esgotado = False
+        self._encerrado = False
+        self._pool = None
+        self._thread: Optional[threading.Thread] = None
+        self._usados: Optional[int] = None    # bytes dos PDFs registrados (conferido com o disco)
+        self.gerados = 0
+
+    # ------------------------------------------------------------------
+    # Entrada
+    # ------------------------------------------------------------------
+
+    def visiveis(self, chaves: Iterable[str]) -> int:
+        """Substitui as linhas visíveis pendentes pelas da tela atual (na ordem da tela)."""
+        with self._cond:
+            self._geracao_visivel += 1
+            for chave, prioridade in list(self._na_fila.items()):
+                if prioridade == PRIORIDADE_VISIVEL:
+                    del self._na_fila[chave]   # entrada antiga vira lixo no heap
+            return self._enfileirar(chaves, PRIORIDADE_VISIVEL)
+
+    def recentes(self, chaves: Iterable[str]) -> int:
+        """Notas que acabaram de chegar (atrás das visíveis)."""
+        with self._cond:
+            return self._enfileirar(chaves, PRIORIDADE_RECENTE)
+
+    def _enfileirar(self, chaves: Iterable[str], prioridade: int) -> int:
+        if self._esgotado or self._encerrado:
+            return 0
+        total = 0
+        for chave in chaves:
+            if (not chave or chave in self._descartados or chave in self._prontos
+                    or chave == self._em_voo or self._na_fila.get(chave, 99) <= prioridade):
+                continue
+            if len(self._na_fila) >= MAX_FILA:
+                break
+            self._na_fila[chave] = prioridade
+            heapq.heappush(self._fila, (prioridade, next(self._ordem), chave, self._geracao_visivel))
+            total += 1
+        if total:
+            self._iniciar_thread()
+            self._cond.notify_all()
+        return total
+
+    @contextmanager
+    def interativo(self):
+        """Enquanto aberto, nenhum documento especulativo novo é enviado."""
+        with self._cond:
+            self._interativos += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._interativos -= 1
+                self._cond.notify_all()
+
+    def aguardar(self, chave: str, timeout: float = 30.0) -> Optional[str]:
+        """PDF da chave se já foi (ou está sendo) gerado aqui; None se não está em andamento."""
+        with self._cond:
+            if self._em_voo == chave:
+                self._cond.wait_for(lambda: self._em_voo != chave, timeout)
+            caminho = self._prontos.get(chave)
+        return caminho if caminho and os.path.exists(caminho) else None
+
+    def encerrar(self):
+        with self._cond:
+            self._encerrado = True
+            self._fila.clear()
+            self._na_fila.clear()
+            self._cond.notify_all()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------
+    # Trabalho
+    # ------------------------------------------------------------------
+
+    def _iniciar_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._trabalhar, name="pdf-especulativo", daemon=True)
+            self._thread.start()
+
+    def _proxima(self) -> Optional[str]:
+        """Próxima chave válida da fila (chamado com self._cond)."""
+        while self._fila:
+            prioridade, _, chave, geracao = heapq.heappop(self._fila)
+            if self._na_fila.get(chave) != prioridade:
+                continue   # substituída por visiveis() ou promovida
+            if prioridade == PRIORIDADE_VISIVEL and geracao != self._geracao_visivel:
+                continue
+            del self._na_fila[chave]
+            return chave
+        return None
+
+    def _trabalhar(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._encerrado or (self._fila and not self._interativos))
+                if self._encerrado:
+                    return
+                chave = self._proxima()
+                if chave is None:
+                    continue
+                self._em_voo = chave
+            try:
+                self._gerar(chave)
+            except Exception as e:
+                self._descartados.add(chave)
+                logger.debug(f"[PDF-ESPECULATIVO] {chave[:20]}…: {e}")
+            finally:
+                with self._cond:
+                    self._em_voo = None
+                    self._cond.notify_all()
+
+    def _trabalho_para(self, chave: str) -> Optional[TrabalhoPDF]:
+        """XML e destino da nota, ou None se não há o que gerar."""
+        with self.db._connect() as conn:
+            row = conn.execute("SELECT tipo, xml_status, pdf_path FROM notas_detalhadas WHERE chave = ?",
+                               (chave,)).fetchone()
+            if not row:
+                return None
+            tipo, xml_status, pdf_path = row
+            tipo = _TIPOS.get(str(tipo or '').upper().replace('-', '').replace(' ', ''))
+            if not tipo or str(xml_status or '').upper() in _SEM_PDF:
+                return None
+            if pdf_path and os.path.exists(pdf_path):
+                return None
+            doc = localizar_em_lote(conn, [chave]).get(chave)
+        if doc is None or not doc.xmls:
+            return None
+        if any(os.path.exists(p) for p in doc.pdfs):
+            return None   # PDF ao lado do XML já existe (o duplo clique o encontra)
+        destino = caminho_solto(doc.xmls[0]).with_suffix('.pdf')
+        return TrabalhoPDF(doc.xmls[0], str(destino), tipo, chave)
+
+    def _disco_disponivel(self, destino: Path) -> bool:
+        if self._usados is None or self._usados >= self.orcamento:
+            with self.db._connect() as conn:
+                self._usados = bytes_em_disco(conn)
+        if self._usados >= self.orcamento:
+            motivo = f"orçamento de {self.orcamento // (1024 * 1024)} MB atingido"
+        else:
+            pasta = next((p for p in destino.parents if p.exists()), None)
+            if pasta is None or shutil.disk_usage(str(pasta)).free >= self.reserva_livre:
+                return True
+            motivo = "pouco espaço livre em disco"
+        with self._cond:
+            self._esgotado = True
+            self._fila.clear()
+            self._na_fila.clear()
+        logger.info(f"⏸️ [PDF-ESPECULATIVO] Pré-geração desligada: {motivo}")
+        return False
+
+    def _renderizar(self, trabalho: TrabalhoPDF) -> ResultadoPDF:
+        if self.usar_processo and self._pool is None:
+            try:
+                self._pool = ProcessPoolExecutor(max_workers=1, initializer=_prioridade_ociosa)
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"⚠️ [PDF-ESPECULATIVO] Processo indisponível ({e}) — gerando na thread")
+                self.usar_processo = False
+        if self._pool is None:
+            return renderizar(trabalho)
+        try:
+            return self._pool.submit(renderizar, trabalho).result()
+        except Exception as e:  # processo morto (BrokenProcessPool): recria no próximo
+            self._pool = None
+            return ResultadoPDF(trabalho, False, erro=f"{type(e).__name__}: {e}")
+
+    def _gerar(self, chave: str):
+        trabalho = self._trabalho_para(chave)
+        if trabalho is None:
+            self._descartados.add(chave)
+            return
+        destino = Path(trabalho.out_path)
+        if not self._disco_disponivel(destino):
+            return
+        resultado = self._renderizar(trabalho)
+        if not resultado.ok:
+            self._descartados.add(chave)
+            logger.debug(f"[PDF-ESPECULATIVO] {chave[:20]}…: {resultado.erro}")
+            return
+        caminho = str(destino.resolve())
+        self.db.atualizar_pdf_path(chave, caminho, resultado.pdf_tipo)
+        tamanho = destino.stat().st_size
+        with self.db._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO pdf_especulativo (chave, caminho, bytes) VALUES (?, ?, ?)",
+                         (chave, caminho, tamanho))
+            conn.commit()
+        self._usados = (self._usados or 0) + tamanho
+        with self._cond:
+            self._prontos[chave] = caminho
+        self.gerados += 1
+        logger.debug(f"📄 [PDF-ESPECULATIVO] {destino.name} pronto ({resultado.segundos:.2f}s)")
+
+
+_prerenderizador: Optional[PreRenderizadorPDF] = None
+_prerenderizador_lock = threading.Lock()
+
+
+def obter_prerenderizador(db) -> PreRenderizadorPDF:
+    """Instância única no processo (o processo de renderização fica aquecido)."""
+    global _prerenderizador
+    with _prerenderizador_lock:
+        if _prerenderizador is None:
+            _prerenderizador = PreRenderizadorPDF(db)
+        return _prerenderizador
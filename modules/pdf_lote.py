@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Geração de DANFE/DACTE/DANFCE/DANFSe em lote.
+
+pdf_simple.generate_danfe_pdf é chamado documento a documento: a cada
+chamada importa o gerador, relê o XML e (NFS-e) grava o log de depuração em
+APPDATA. Para "gerar os PDFs do mês" (milhares de notas) isso vira um
+serviço de madrugada. Aqui:
+
+    - os trabalhos (xml, pdf de saída, tipo) são distribuídos num pool de
+      processos do tamanho dos núcleos (a renderização é CPU — thread não
+      ajuda por causa do GIL);
+    - cada processo aquece uma única vez (_aquecer): importa BrazilFiscalReport
+      (Danfe/Dacte), gerar_danfce, gerar_danfse_profissional, reportlab e
+      qrcode, e desliga o log de depuração em arquivo;
+    - o processo lê o XML do disco (só o caminho atravessa o pipe), grava
+      num temporário na mesma pasta e troca com os.replace — um PDF pela
+      metade nunca fica com o nome final;
+    - cada resultado traz o tempo do documento; resumir() dá a vazão do lote.
+
+Uso:
+    trabalhos = [TrabalhoPDF(str(xml), str(xml.with_suffix('.pdf')), 'NFe')]
+    for resultado in renderizar_lote(trabalhos):
+        ...
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from modules.arquivo_mensal import is_caminho_arquivado, ler_xml
+
+logger = logging.getLogger('nfe_search')
+
+JANELA_POR_PROCESSO = 4     # trabalhos em voo por processo (cancelamento responde rápido)
+
+_aquecido = False
+
+
+@dataclass
+class TrabalhoPDF:
+    xml_path: str
+    out_path: str
+    tipo: str = "NFe"
+    chave: str = ""
+
+
+@dataclass
+class ResultadoPDF:
+    trabalho: TrabalhoPDF
+    ok: bool
+    pdf_tipo: Optional[str] = None
+    segundos: float = 0.0
+    erro: str = ""
+
+
+def detectar_tipo(xml_text: str) -> Optional[str]:
+    """NFe/CTe/NFCe/NFS-e pelo conteúdo; None para eventos, resumos e afins (sem PDF)."""
+    if '<cteProc' in xml_text:
+        return "CTe"
+    if 'sped.fazenda.gov.br/nfse' in xml_text or 'abrasf.org.br' in xml_text or 'ListaNotaFiscal' in xml_text:
+        return "NFS-e"
+    if '<nfeProc' in xml_text:
+        return "NFCe" if '<mod>65</mod>' in xml_text else "NFe"
+    return None
+
+
+def _aquecer():
+    """Inicializador do processo: importa os geradores uma vez e silencia o log em arquivo."""
+    global _aquecido
+    if _aquecido:
+        return
+    from modules import pdf_simple
+    pdf_simple.DEBUG_ARQUIVO = False
+    for modulo in ('brazilfiscalreport.danfe', 'brazilfiscalreport.dacte', 'gerar_danfce',
+                   'gerar_danfse_profissional', 'reportlab.pdfgen.canvas', 'qrcode', 'lxml.etree'):
+        try:
+            __import__(modulo)
+        except Exception:
+            pass  # o gerador correspondente cai no fallback de pdf_simple
+    _aquecido = True
+
+
+def _temporario(destino: Path) -> Path:
+    return destino.with_name(f".{destino.stem}.{os.getpid()}.tmp.pdf")
+
+
+def renderizar(trabalho: TrabalhoPDF) -> ResultadoPDF:
+    """Gera UM PDF (no processo atual) com escrita atômica."""
+    _aquecer()
+    from modules.pdf_simple import generate_danfe_pdf
+
+    inicio = time.perf_counter()
+    destino = Path(trabalho.out_path)
+    tmp = _temporario(destino)
+    try:
+        if is_caminho_arquivado(trabalho.xml_path):
+            xml_text = ler_xml(trabalho.xml_path)  # membro do arquivo mensal (.zip)
+            if xml_text is None:
+                raise FileNotFoundError(trabalho.xml_path)
+        else:
+            xml_text = Path(trabalho.xml_path).read_text(encoding='utf-8')
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        bruto = generate_danfe_pdf(xml_text, str(tmp), trabalho.tipo, xml_source_path=trabalho.xml_path)
+        ok = bruto.get("ok") if isinstance(bruto, dict) else bool(bruto)
+        pdf_tipo = bruto.get("pdf_tipo") if isinstance(bruto, dict) else None
+        if ok and tmp.exists():
+            os.replace(tmp, destino)
+            return ResultadoPDF(trabalho, True, pdf_tipo, time.perf_counter() - inicio)
+        return ResultadoPDF(trabalho, False, None, time.perf_counter() - inicio, "gerador não produziu o PDF")
+    except Exception as e:
+        return ResultadoPDF(trabalho, False, None, time.perf_counter() - inicio, f"{type(e).__name__}: {e}")
+    finally:
+        try:
+            if tmp.exists():
+                tmp.unlink()
+        except OSError:
+            pass
+
+
+def renderizar_lote(trabalhos: Iterable[TrabalhoPDF], processos: Optional[int] = None,
+                    cancelado: Optional[Callable[[], bool]] = None) -> Iterator[ResultadoPDF]:
+    """
+    Gera os PDFs em paralelo e devolve os resultados à medida que ficam
+    prontos. `cancelado()` verdadeiro para de enviar trabalhos (os que já
+    estão em voo terminam). Sem pool disponível, gera no próprio processo.
+    """
+    trabalhos = list(trabalhos)
+    if not trabalhos:
+        return
+    processos = max(1, min(processos or os.cpu_count() or 1, len(trabalhos)))
+    cancelado = cancelado or (lambda: False)
+
+    if processos == 1:
+        for trabalho in trabalhos:
+            if cancelado():
+                return
+            yield renderizar(trabalho)
+        return
+
+    try:
+        pool = ProcessPoolExecutor(max_workers=processos, initializer=_aquecer)
+    except (OSError, NotImplementedError) as e:
+        logger.warning(f"⚠️ [PDF-LOTE] Pool de processos indisponível ({e}) — gerando no processo atual")
+        yield from renderizar_lote(trabalhos, processos=1, cancelado=cancelado)
+        return
+
+    logger.info(f"🖨️ [PDF-LOTE] {len(trabalhos)} PDF(s) em {processos} processo(s)")
+    pendentes = iter(trabalhos)
+    em_voo: Dict = {}  # futuro → trabalho
+    try:
+        while True:
+            while len(em_voo) < processos * JANELA_POR_PROCESSO and not cancelado():
+                trabalho = next(pendentes, None)
+                if trabalho is None:
+                    break
+                em_voo[pool.submit(renderizar, trabalho)] = trabalho
+            if not em_voo:
+                break
+            prontos, _ = wait(list(em_voo), return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                trabalho = em_voo.pop(futuro)
+                try:
+                    yield futuro.result()
+                except Exception as e:  # processo morto (BrokenProcessPool) etc.
+                    yield ResultadoPDF(trabalho, False, erro=f"{type(e).__name__}: {e}")
+    finally:
+        for futuro in em_voo:
+            futuro.cancel()
+        pool.shutdown(wait=True)
+
+
+def resumir(resultados: List[ResultadoPDF], segundos_total: float) -> Dict[str, float]:
+    """Vazão do lote: gerados, falhas, média/máximo por documento e PDFs por minuto."""
+    tempos = [r.segundos for r in resultados]
+    return {
+        'gerados': sum(1 for r in resultados if r.ok),
+        'falhas': sum(1 for r in resultados if not r.ok),
+        'media_s': round(sum(tempos) / len(tempos), 3) if tempos else 0.0,
+        'max_s': round(max(tempos), 3) if tempos else 0.0,
+        'por_minuto': round(len(resultados) * 60 / segundos_total, 1) if segundos_total > 0 else 0.0,
+    }
@@ -4,6 +4,9 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Optional
 
+# Log de depuração da NFS-e em APPDATA; a geração em lote (modules/pdf_lote) desliga
+DEBUG_ARQUIVO = True
+
 
 def generate_danfe_pdf(xml_text: str, out_path: str, tipo: str = "NFe",
                        xml_source_path: Optional[str] = None) -> bool:
@@ -24,6 +27,8 @@ def generate_danfe_pdf(xml_text: str, out_path: str, tipo: str = "NFe",
     # 🔍 DEBUG: Log detalhado para NFS-e
     def debug_log(msg):
         """Salva log de debug em AppData/Roaming/Busca XML/logs"""
+        if not DEBUG_ARQUIVO:
+            return
         try:
             import os
             # AppData\Roaming\Busca XML\logs
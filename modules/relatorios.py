@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Relatórios IBS/CBS e de Notas sobre as colunas tipadas de notas_detalhadas.
+
+abrir_relatorio/abrir_relatorio_notas buscavam todas as linhas do período,
+preenchiam um QTableWidget célula a célula, relíam o XML das notas sem
+IBS/CBS no banco, somavam os totais convertendo o texto formatado das células
+e exportavam montando o Workbook inteiro na memória. Aqui:
+
+    - a consulta roda em SQL sobre as colunas normalizadas (centavos, data
+      ISO — modules/colunas_normalizadas) e é lida em páginas (Paginador,
+      uma consulta LIMIT/OFFSET por página, encerrada na hora — nenhum
+      cursor fica aberto entre rolagens segurando o lock do banco): a tela
+      só materializa o que foi rolado;
+    - totais e agrupamentos (por mês, emitente, tipo, empresa) são SUM/COUNT
+      no banco;
+    - IBS/CBS vem do que a ingestão já gravou: v_ibs/v_cbs de
+      notas_detalhadas e, para notas antigas sem esses valores, os totais de
+      nfe_docs (xml_indexer) — nenhum XML é relido;
+    - a exportação é em fluxo: openpyxl write_only (ou CSV), linhas direto do
+      cursor para o arquivo, memória constante com qualquer período.
+
+Uso:
+    filtro = FiltroRelatorio('2025-01-01', '2025-12-31')
+    pag = Paginador(conn, RELATORIO_IBS_CBS, filtro)
+    linhas = pag.proximas(500)
+    exportar_xlsx(conn, RELATORIO_IBS_CBS, filtro, "relatorio.xlsx")
+"""
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from modules.colunas_normalizadas import formatar_centavos, iso_para_br, sql_centavos
+
+logger = logging.getLogger('nfe_search')
+
+TAMANHO_PAGINA = 500
+LOTE_EXPORTACAO = 2000
+
+
+def _sql_ibs_cbs(campo: str) -> str:
+    """Valor normalizado da nota; vazio (nota antiga, gravada como '') → totais indexados em nfe_docs."""
+    indexado = sql_centavos(f"NULLIF(trim(d.{campo}), '')")
+    return f"COALESCE(CASE WHEN trim(COALESCE(n.{campo}, '')) <> '' THEN n.{campo}_centavos END, {indexado})"
+
+
+SQL_IBS = _sql_ibs_cbs('v_ibs')
+SQL_CBS = _sql_ibs_cbs('v_cbs')
+_FROM = "FROM notas_detalhadas n LEFT JOIN nfe_docs d ON d.chave = n.chave"
+
+AGRUPAMENTOS = {
+    'mes': ("Mês", "substr(n.data_emissao_iso, 1, 7)"),
+    'emitente': ("Emitente", "COALESCE(n.cnpj_emitente, '') || ' - ' || COALESCE(n.nome_emitente, '')"),
+    'tipo': ("Tipo", "COALESCE(n.tipo, '')"),
+    'empresa': ("Empresa", "COALESCE(n.informante, '')"),
+}
+
+
+@dataclass(frozen=True)
+class Coluna:
+    titulo: str
+    sql: str
+    formato: str = 'texto'      # 'texto' | 'moeda' (centavos) | 'data' (ISO) | 'inteiro'
+    largura: int = 15
+
+
+@dataclass(frozen=True)
+class Relatorio:
+    nome: str
+    colunas: Tuple[Coluna, ...]
+    ordem: str
+    agrupar: str = ''           # expressão GROUP BY ('' = uma linha por nota)
+
+    def indice(self, titulo: str) -> int:
+        return next(i for i, c in enumerate(self.colunas) if c.titulo == titulo)
+
+
+RELATORIO_IBS_CBS = Relatorio("Relatório IBS CBS", (
+    Coluna("Data", "n.data_emissao_iso", 'data', 12),
+    Coluna("Tipo", "n.tipo", largura=8),
+    Coluna("Número", "n.numero", largura=10),
+    Coluna("Emitente", "n.nome_emitente", largura=40),
+    Coluna("Destinatário", "n.cnpj_destinatario", largura=18),
+    Coluna("Valor Total", "n.valor_centavos", 'moeda', 16),
+    Coluna("IBS", SQL_IBS, 'moeda', 14),
+    Coluna("CBS", SQL_CBS, 'moeda', 14),
+    Coluna("Chave", "n.chave", largura=46),
+), ordem="n.data_emissao_iso DESC")
+
+RELATORIO_NOTAS = Relatorio("Relatório de Notas", (
+    Coluna("Nº", "n.numero", largura=10),
+    Coluna("Tipo", "n.tipo", largura=8),
+    Coluna("Data Emissão", "n.data_emissao_iso", 'data', 12),
+    Coluna("Emitente", "n.nome_emitente", largura=40),
+    Coluna("CNPJ Emitente", "n.cnpj_emitente", largura=18),
+    Coluna("Destinatário", "n.nome_destinatario", largura=40),
+    Coluna("CNPJ Dest.", "n.cnpj_destinatario", largura=18),
+    Coluna("Valor Total", "n.valor_centavos", 'moeda', 16),
+    Coluna("IBS", SQL_IBS, 'moeda', 14),
+    Coluna("CBS", SQL_CBS, 'moeda', 14),
+    Coluna("Status", "n.status", largura=30),
+    Coluna("Chave", "n.chave", largura=46),
+), ordem="n.data_emissao_iso DESC, n.numero DESC")
+
+
+def relatorio_agrupado(por: str) -> Relatorio:
+    """Uma linha por grupo (AGRUPAMENTOS): documentos, valor, IBS e CBS somados no banco."""
+    titulo, expr = AGRUPAMENTOS[por]
+    return Relatorio(f"Resumo por {titulo.lower()}", (
+        Coluna(titulo, expr, largura=40),
+        Coluna("Documentos", "COUNT(*)", 'inteiro', 12),
+        Coluna("Valor Total", "SUM(COALESCE(n.valor_centavos, 0))", 'moeda', 18),
+        Coluna("IBS", f"SUM(COALESCE({SQL_IBS}, 0))", 'moeda', 16),
+        Coluna("CBS", f"SUM(COALESCE({SQL_CBS}, 0))", 'moeda', 16),
+    ), ordem="1", agrupar=expr)
+
+
+@dataclass
+class FiltroRelatorio:
+    data_ini: str                   # 'AAAA-MM-DD'
+    data_fim: str
+    cnpj: Optional[str] = None
+    tipo: Optional[str] = None      # 'NFE' | 'CTE' | 'NFSE'
+    escopo: str = 'destinatario'    # IBS/CBS: notas recebidas; 'envolvida': recebidas, emitidas ou do informante
+
+    def where(self) -> Tuple[str, List]:
+        sql = "WHERE n.data_emissao_iso BETWEEN ? AND ?"
+        params: List = [self.data_ini, self.data_fim]
+        if self.cnpj:
+            if self.escopo == 'envolvida':
+                sql += " AND (n.cnpj_destinatario = ? OR n.cnpj_emitente = ? OR n.informante = ?)"
+                params += [self.cnpj] * 3
+            else:
+                # NFS-e: a empresa é o informante
+                sql += " AND (n.cnpj_destinatario = ? OR (n.tipo LIKE '%NFS%' AND n.informante = ?))"
+                params += [self.cnpj] * 2
+        if self.tipo == 'NFSE':
+            sql += " AND n.tipo LIKE '%NFS%'"
+        elif self.tipo:
+            sql += " AND UPPER(REPLACE(REPLACE(n.tipo, '-', ''), ' ', '')) = ?"
+            params.append(self.tipo)
+        return sql, params
+
+
+def consulta(relatorio: Relatorio, filtro: FiltroRelatorio,
+             ordem: Optional[str] = None) -> Tuple[str, List]:
+    where, params = filtro.where()
+    colunas = ", ".join(c.sql for c in relatorio.colunas)
+    sql = f"SELECT {colunas} {_FROM} {where}"
+    if relatorio.agrupar:
+        sql += f" GROUP BY {relatorio.agrupar}"
+    return f"{sql} ORDER BY {ordem or relatorio.ordem}", params
+
+
+def totais(conn: sqlite3.Connection, filtro: FiltroRelatorio) -> Dict[str, int]:
+    """Documentos e somas (centavos) do filtro; 'sem_ibs_cbs' = notas sem IBS/CBS gravado."""
+    where, params = filtro.where()
+    row = conn.execute(f'''
+        SELECT COUNT(*), SUM(COALESCE(n.valor_centavos, 0)),
+               SUM(COALESCE({SQL_IBS}, 0)), SUM(COALESCE({SQL_CBS}, 0)),
+               SUM(CASE WHEN {SQL_IBS} IS NULL AND {SQL_CBS} IS NULL THEN 1 ELSE 0 END)
+        {_FROM} {where}
+    ''', params).fetchone()
+    return {'documentos': row[0] or 0, 'valor': row[1] or 0, 'ibs': row[2] or 0,
+            'cbs': row[3] or 0, 'sem_ibs_cbs': row[4] or 0}
+
+
+def formatar(valor, formato: str) -> str:
+    """Texto de exibição de um valor cru da consulta."""
+    if formato == 'moeda':
+        return formatar_centavos(valor if valor is not None else 0)
+    if formato == 'data':
+        return iso_para_br(valor) or (valor or "")
+    return "" if valor is None else str(valor)
+
+
+class Paginador:
+    """
+    Linhas do relatório sob demanda. Cada página é uma consulta própria
+    (LIMIT/OFFSET) lida até o fim: sem WAL, um cursor pela metade entre
+    duas rolagens seguraria o lock SHARED e todo escritor em segundo plano
+    receberia "database is locked".
+    """
+
+    def __init__(self, conn: sqlite3.Connection, relatorio: Relatorio, filtro: FiltroRelatorio,
+                 ordem: Optional[str] = None):
+        self.relatorio = relatorio
+        self._conn = conn
+        sql, self._params = consulta(relatorio, filtro, ordem)
+        # Desempate estável: empate na ordem não repete nem pula linha entre páginas
+        self._sql = f"{sql}, {relatorio.agrupar or 'n.rowid'} LIMIT ? OFFSET ?"
+        self._lidas = 0
+        self.esgotado = False
+
+    def proximas(self, quantidade: int = TAMANHO_PAGINA) -> List[tuple]:
+        if self.esgotado:
+            return []
+        linhas = self._conn.execute(self._sql, [*self._params, quantidade, self._lidas]).fetchall()
+        self._lidas += len(linhas)
+        if len(linhas) < quantidade:
+            self.fechar()
+        return linhas
+
+    def fechar(self):
+        self.esgotado = True
+
+
+def _linhas(conn, relatorio, filtro, ordem=None) -> Iterator[tuple]:
+    sql, params = consulta(relatorio, filtro, ordem)
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            lote = cursor.fetchmany(LOTE_EXPORTACAO)
+            if not lote:
+                return
+            yield from lote
+    finally:
+        cursor.close()
+
+
+def _temporario(destino: Path) -> Path:
+    return destino.with_name(f".{destino.stem}.{os.getpid()}.tmp{destino.suffix}")
+
+
+def exportar_xlsx(conn: sqlite3.Connection, relatorio: Relatorio, filtro: FiltroRelatorio,
+                  caminho: Union[str, Path], agrupamentos: Sequence[str] = ('mes',),
+                  ordem: Optional[str] = None,
+                  progresso: Optional[Callable[[int], None]] = None,
+                  cancelado: Optional[Callable[[], bool]] = None) -> int:
+    """
+    Grava o relatório em .xlsx (openpyxl write_only): uma aba com as notas
+    e uma aba de resumo por agrupamento. Moeda sai como número e data como
+    data (somáveis/filtráveis no Excel). Retorna quantas linhas foram escritas.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    destino = Path(caminho)
+    tmp = _temporario(destino)
+    fundo = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    fonte = Font(color="FFFFFF", bold=True)
+    centro = Alignment(horizontal="center", vertical="center")
+    cancelado = cancelado or (lambda: False)
+
+    def aba(wb, rel, linhas, contar=False):
+        ws = wb.create_sheet(rel.nome[:31])
+        for i, col in enumerate(rel.colunas, 1):
+            ws.column_dimensions[get_column_letter(i)].width = col.largura
+        cabecalho = []
+        for col in rel.colunas:
+            cell = WriteOnlyCell(ws, value=col.titulo)
+            cell.fill, cell.font, cell.alignment = fundo, fonte, centro
+            cabecalho.append(cell)
+        ws.append(cabecalho)
+        escritas = 0
+        for linha in linhas:
+            saida = []
+            for col, valor in zip(rel.colunas, linha):
+                if col.formato == 'moeda':
+                    cell = WriteOnlyCell(ws, value=(valor or 0) / 100)
+                    cell.number_format = '#,##0.00'
+                elif col.formato == 'data' and valor and len(valor) >= 10:
+                    try:
+                        cell = WriteOnlyCell(ws, value=date.fromisoformat(valor[:10]))
+                        cell.number_format = 'DD/MM/YYYY'
+                    except ValueError:
+                        cell = WriteOnlyCell(ws, value=valor)
+                else:
+                    cell = WriteOnlyCell(ws, value=valor)
+                saida.append(cell)
+            ws.append(saida)
+            escritas += 1
+            if contar and escritas % LOTE_EXPORTACAO == 0:
+                if progresso:
+                    progresso(escritas)
+                if cancelado():
+                    raise InterruptedError("Exportação cancelada")
+        return escritas
+
+    wb = Workbook(write_only=True)
+    try:
+        escritas = aba(wb, relatorio, _linhas(conn, relatorio, filtro, ordem), contar=True)
+        for por in agrupamentos:
+            rel = relatorio_agrupado(por)
+            aba(wb, rel, _linhas(conn, rel, filtro))
+        wb.save(tmp)
+        os.replace(tmp, destino)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    if progresso:
+        progresso(escritas)
+    logger.info(f"📊 [RELATÓRIO] {relatorio.nome}: {escritas} linha(s) → {destino}")
+    return escritas
+
+
+def exportar_csv(conn: sqlite3.Connection, relatorio: Relatorio, filtro: FiltroRelatorio,
+                 caminho: Union[str, Path], ordem: Optional[str] = None,
+                 progresso: Optional[Callable[[int], None]] = None,
+                 cancelado: Optional[Callable[[], bool]] = None) -> int:
+    """CSV no padrão do Excel brasileiro (';', vírgula decimal, UTF-8 com BOM)."""
+    destino = Path(caminho)
+    tmp = _temporario(destino)
+    cancelado = cancelado or (lambda: False)
+    escritas = 0
+    try:
+        with open(tmp, 'w', newline='', encoding='utf-8-sig') as f:
+            escritor = csv.writer(f, delimiter=';')
+            escritor.writerow([c.titulo for c in relatorio.colunas])
+            for linha in _linhas(conn, relatorio, filtro, ordem):
+                escritor.writerow([
+                    f"{(v or 0) / 100:.2f}".replace('.', ',') if c.formato == 'moeda' else formatar(v, c.formato)
+                    for c, v in zip(relatorio.colunas, linha)
+                ])
+                escritas += 1
+                if escritas % LOTE_EXPORTACAO == 0:
+                    if progresso:
+                        progresso(escritas)
+                    if cancelado():
+                        raise InterruptedError("Exportação cancelada")
+        os.replace(tmp, destino)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    if progresso:
+        progresso(escritas)
+    logger.info(f"📊 [RELATÓRIO] {relatorio.nome}: {escritas} linha(s) → {destino}")
+    return escritas
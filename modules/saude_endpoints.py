@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Saúde dos webservices (SEFAZ, ADN, prefeituras) compartilhada no processo.
+
+Sem isto cada certificado descobre sozinho, pelos próprios timeouts, que um
+endpoint caiu — com 10 certificados são 10 esperas de 30–60 s (e, no
+ciclo_nsu, até 10 min de "modo investigação" por certificado).
+
+Cada endpoint (URL sem query) tem:
+    - latência média móvel (EWMA) das chamadas bem-sucedidas;
+    - taxa de erro nas últimas JANELA chamadas;
+    - disjuntor (circuit breaker): FECHADO → ABERTO após LIMIAR_FALHAS falhas
+      seguidas (ou taxa de erro alta). Aberto, as chamadas falham na hora
+      (CircuitoAberto). Vencida a espera, UMA chamada de sonda passa
+      (MEIO_ABERTO): sucesso fecha, falha reabre com espera dobrada. Sonda
+      sem resultado registrado em TEMPO_MAXIMO_SONDA é liberada, para que
+      um caminho que esqueceu de registrar não bloqueie o endpoint de vez.
+
+chamar() tenta a lista de URLs (principal + contingência SVRS/SVC) na ordem,
+pulando disjuntores abertos e endpoints muito mais lentos que as alternativas.
+
+Só falhas do endpoint contam (rede, timeout, HTTP 5xx); HTTP 4xx e SOAP
+Fault são respostas do servidor — problema do pedido/certificado. O SOAP
+1.2 devolve Fault com HTTP 500, então 5xx cujo corpo é um Fault também não
+conta.
+
+Uso:
+    from modules.saude_endpoints import registro_compartilhado
+
+    saude = registro_compartilhado()
+    resposta = saude.chamar([url_uf, url_svc], lambda url: sessao.post(url, ...))
+"""
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Sequence, TypeVar
+from urllib.parse import urlsplit
+
+logger = logging.getLogger('nfe_search')
+
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio_aberto"
+
+LIMIAR_FALHAS = 3            # falhas seguidas que abrem o disjuntor
+JANELA = 20                  # chamadas consideradas na taxa de erro
+MIN_AMOSTRAS_TAXA = 10
+TAXA_ERRO_ABERTURA = 0.5
+ESPERA_INICIAL = 30.0        # segundos com o disjuntor aberto
+ESPERA_MAXIMA = 600.0        # teto (mesmo tempo da antiga pausa de investigação)
+TEMPO_MAXIMO_SONDA = 300.0   # s; sonda sem resultado depois disso é dada como perdida
+ALFA_LATENCIA = 0.2
+LATENCIA_LENTA = 10.0        # s; acima disso (e 4x a alternativa) o endpoint vai para o fim
+FATOR_LENTO = 4.0
+
+T = TypeVar('T')
+
+
+class CircuitoAberto(ConnectionError):
+    """Todos os endpoints candidatos estão com o disjuntor aberto."""
+
+
+def chave_endpoint(url: str) -> str:
+    partes = urlsplit(url)
+    return f"{partes.scheme}://{partes.netloc}{partes.path}".lower().rstrip('/')
+
+
+_RE_SOAP_FAULT = re.compile(rb'<(?:[\w.-]+:)?Fault[\s/>]')
+
+
+def resposta_soap_fault(resposta) -> bool:
+    """True se o corpo da resposta HTTP é um SOAP Fault (o servidor processou e recusou)."""
+    corpo = getattr(resposta, 'content', None)
+    if isinstance(corpo, str):
+        corpo = corpo.encode('utf-8', errors='ignore')
+    # O Fault vem logo no início do Body; não varre respostas grandes inteiras
+    return isinstance(corpo, (bytes, bytearray)) and bool(_RE_SOAP_FAULT.search(corpo[:65536]))
+
+
+def falha_do_endpoint(erro: BaseException) -> bool:
+    """Rede/timeout/5xx contam como falha do endpoint; 4xx e 5xx com SOAP Fault não."""
+    resposta = getattr(erro, 'response', None)
+    status = getattr(resposta, 'status_code', None)
+    if status is None:
+        return True
+    return status >= 500 and not resposta_soap_fault(resposta)
+
+
+@dataclass
+class EstadoEndpoint:
+    url: str
+    estado: str = FECHADO
+    falhas_seguidas: int = 0
+    latencia: Optional[float] = None
+    aberto_ate: float = 0.0
+    espera: float = ESPERA_INICIAL
+    sondando: bool = False
+    sonda_desde: float = 0.0
+    ultimo_erro: str = ""
+    recentes: Deque[bool] = field(default_factory=lambda: deque(maxlen=JANELA))
+
+    @property
+    def taxa_erro(self) -> float:
+        return self.recentes.count(False) / len(self.recentes) if self.recentes else 0.0
+
+
+class RegistroSaude:
+    def __init__(self, relogio: Callable[[], float] = time.monotonic):
+        self._relogio = relogio
+        self._estados: Dict[str, EstadoEndpoint] = {}
+        self._lock = threading.Lock()
+
+    def _estado(self, url: str) -> EstadoEndpoint:
+        chave = chave_endpoint(url)
+        estado = self._estados.get(chave)
+        if estado is None:
+            estado = self._estados[chave] = EstadoEndpoint(chave)
+        return estado
+
+    def _atualizar_tempo(self, estado: EstadoEndpoint, agora: float):
+        if estado.estado == ABERTO and agora >= estado.aberto_ate:
+            estado.estado = MEIO_ABERTO
+            estado.sondando = False
+        elif estado.sondando and agora - estado.sonda_desde >= TEMPO_MAXIMO_SONDA:
+            logger.warning(f"⚠️ [SAÚDE] Sonda de {estado.url} sem resultado há {TEMPO_MAXIMO_SONDA:.0f}s — liberada")
+            estado.sondando = False
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def disponivel(self, url: str) -> bool:
+        """True se uma chamada agora não seria recusada (não reserva a sonda)."""
+        with self._lock:
+            estado = self._estado(url)
+            self._atualizar_tempo(estado, self._relogio())
+            return estado.estado == FECHADO or (estado.estado == MEIO_ABERTO and not estado.sondando)
+
+    def permite(self, url: str) -> bool:
+        """Como disponivel(), mas em MEIO_ABERTO reserva a única chamada de sonda."""
+        with self._lock:
+            estado = self._estado(url)
+            self._atualizar_tempo(estado, self._relogio())
+            if estado.estado == FECHADO:
+                return True
+            if estado.estado == MEIO_ABERTO and not estado.sondando:
+                estado.sondando = True
+                estado.sonda_desde = self._relogio()
+                return True
+            return False
+
+    def espera_restante(self, url: str) -> float:
+        with self._lock:
+            estado = self._estado(url)
+            return max(0.0, estado.aberto_ate - self._relogio()) if estado.estado == ABERTO else 0.0
+
+    def ordenar(self, urls: Sequence[str]) -> List[str]:
+        """
+        Candidatos sem repetição: disponíveis primeiro, na ordem dada, exceto
+        os muito mais lentos que o mais rápido disponível; depois os abertos.
+        """
+        unicas = list(dict.fromkeys(u for u in urls if u))
+        with self._lock:
+            agora = self._relogio()
+            estados = {u: self._estado(u) for u in unicas}
+            for estado in estados.values():
+                self._atualizar_tempo(estado, agora)
+        disponiveis = [u for u in unicas if estados[u].estado != ABERTO]
+        abertas = [u for u in unicas if estados[u].estado == ABERTO]
+        latencias = [estados[u].latencia for u in disponiveis if estados[u].latencia is not None]
+        if latencias:
+            melhor = min(latencias)
+
+            def _lento(u):
+                lat = estados[u].latencia
+                return lat is not None and lat > LATENCIA_LENTA and lat > melhor * FATOR_LENTO
+
+            disponiveis = [u for u in disponiveis if not _lento(u)] + [u for u in disponiveis if _lento(u)]
+        return disponiveis + abertas
+
+    def resumo(self) -> List[Dict]:
+        with self._lock:
+            agora = self._relogio()
+            for estado in self._estados.values():
+                self._atualizar_tempo(estado, agora)
+            return [{
+                'url': e.url, 'estado': e.estado, 'latencia': e.latencia,
+                'taxa_erro': round(e.taxa_erro, 2), 'ultimo_erro': e.ultimo_erro,
+            } for e in self._estados.values()]
+
+    # ------------------------------------------------------------------
+    # Registro
+    # ------------------------------------------------------------------
+
+    def registrar_sucesso(self, url: str, latencia: Optional[float] = None):
+        with self._lock:
+            estado = self._estado(url)
+            if estado.estado != FECHADO:
+                logger.info(f"✅ [SAÚDE] {estado.url} voltou a responder — disjuntor fechado")
+            estado.estado = FECHADO
+            estado.falhas_seguidas = 0
+            estado.sondando = False
+            estado.espera = ESPERA_INICIAL
+            estado.recentes.append(True)
+            if latencia is not None:
+                estado.latencia = latencia if estado.latencia is None else \
+                    ALFA_LATENCIA * latencia + (1 - ALFA_LATENCIA) * estado.latencia
+
+    def registrar_falha(self, url: str, erro: object = ""):
+        with self._lock:
+            agora = self._relogio()
+            estado = self._estado(url)
+            estado.falhas_seguidas += 1
+            estado.recentes.append(False)
+            estado.ultimo_erro = str(erro)[:200]
+            taxa_alta = len(estado.recentes) >= MIN_AMOSTRAS_TAXA and estado.taxa_erro >= TAXA_ERRO_ABERTURA
+            if estado.estado == MEIO_ABERTO:
+                # Sonda falhou: reabre por mais tempo
+                estado.espera = min(ESPERA_MAXIMA, estado.espera * 2)
+                self._abrir(estado, agora)
+            elif estado.estado == FECHADO and (estado.falhas_seguidas >= LIMIAR_FALHAS or taxa_alta):
+                self._abrir(estado, agora)
+
+    def _abrir(self, estado: EstadoEndpoint, agora: float):
+        estado.estado = ABERTO
+        estado.sondando = False
+        estado.aberto_ate = agora + estado.espera
+        logger.warning(f"⛔ [SAÚDE] {estado.url} indisponível ({estado.ultimo_erro[:80]}) — "
+                       f"chamadas suspensas por {estado.espera:.0f}s")
+
+    # ------------------------------------------------------------------
+    # Execução com failover
+    # ------------------------------------------------------------------
+
+    def chamar(self, urls: Sequence[str], funcao: Callable[[str], T]) -> T:
+        """
+        Executa funcao(url) no primeiro candidato disponível; em falha do
+        endpoint passa para o próximo. Erros que não são do endpoint (4xx,
+        SOAP Fault) contam como resposta e sobem direto.
+        """
+        ultimo_erro: Optional[BaseException] = None
+        for url in self.ordenar(urls):
+            if not self.permite(url):
+                continue
+            inicio = self._relogio()
+            try:
+                resultado = funcao(url)
+            except Exception as e:
+                if not falha_do_endpoint(e):
+                    self.registrar_sucesso(url, self._relogio() - inicio)
+                    raise
+                self.registrar_falha(url, e)
+                ultimo_erro = e
+                logger.warning(f"⚠️ [SAÚDE] Falha em {chave_endpoint(url)}: {str(e)[:120]}")
+                continue
+            self.registrar_sucesso(url, self._relogio() - inicio)
+            return resultado
+        if ultimo_erro is not None:
+            raise ultimo_erro
+        raise CircuitoAberto(f"Endpoint(s) indisponível(is): {', '.join(chave_endpoint(u) for u in urls if u)}")
+
+
+_registro = RegistroSaude()
+
+
+def registro_compartilhado() -> RegistroSaude:
+    return _registro
@@ -0,0 +1,765 @@
+# -*- coding: utf-8 -*-
+"""
+Versionamento do esquema do banco notas.db.
+
+Antes, cada construção de DatabaseManager (nfe_search e modules/database)
+reexecutava dezenas de CREATE TABLE IF NOT EXISTS, ALTER TABLE em try/except,
+CREATE INDEX e PRAGMA table_info — e o ciclo de NSU repetia parte disso a cada
+documento. Agora o esquema é descrito por uma lista ordenada de migrações e a
+versão aplicada fica registrada na tabela `schema_version`:
+
+    versao | descricao | aplicada_em
+
+`aplicar_migracoes(db_path)` aplica só as migrações pendentes (dentro de uma
+transação BEGIN IMMEDIATE, seguro com a interface e o processo de busca abertos
+ao mesmo tempo). Depois da primeira chamada no processo, o caminho fica em
+cache e as chamadas seguintes não tocam no banco.
+
+Para evoluir o esquema, acrescente uma nova entrada no FINAL de MIGRACOES —
+nunca altere uma migração já publicada.
+
+Uso:
+    from modules.schema_migrations import aplicar_migracoes, versao_atual
+
+    aplicar_migracoes(get_data_dir() / "notas.db")
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+# Bancos já migrados neste processo (caminho resolvido)
+_bancos_migrados = set()
+_lock = threading.Lock()
+
+
+# ---------------------------------------------------------------------------
+# Auxiliares (usados apenas durante a migração)
+# ---------------------------------------------------------------------------
+
+def _garantir_colunas(conn: sqlite3.Connection, tabela: str, colunas: Sequence[Tuple[str, str]]):
+    """Adiciona as colunas ausentes (bancos antigos criados sem elas)."""
+    existentes = {row[1] for row in conn.execute(f"PRAGMA table_info({tabela})")}
+    for nome, tipo in colunas:
+        if nome not in existentes:
+            conn.execute(f"ALTER TABLE {tabela} ADD COLUMN {nome} {tipo}")
+            print(f"[MIGRAÇÃO] Coluna {tabela}.{nome} adicionada")
+
+
+# ---------------------------------------------------------------------------
+# Migrações
+# ---------------------------------------------------------------------------
+
+def _m001_esquema_base(conn: sqlite3.Connection):
+    """União do que os dois _initialize e criar_tabela_detalhada criavam."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS certificados (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cnpj_cpf TEXT,
+        caminho TEXT,
+        senha TEXT,
+        informante TEXT,
+        cUF_autor TEXT,
+        ativo INTEGER DEFAULT 1,
+        criado_em TEXT,
+        razao_social TEXT,
+        nome_certificado TEXT
+    )''')
+    _garantir_colunas(conn, "certificados", [
+        ("ativo", "INTEGER DEFAULT 1"),
+        ("criado_em", "TEXT"),
+        ("razao_social", "TEXT"),
+        ("nome_certificado", "TEXT"),
+    ])
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS xmls_baixados (
+        chave TEXT PRIMARY KEY,
+        cnpj_cpf TEXT,
+        caminho_arquivo TEXT,
+        xml_completo TEXT,
+        baixado_em TEXT
+    )''')
+    _garantir_colunas(conn, "xmls_baixados", [("xml_completo", "TEXT")])
+
+    # 📂 Caminhos salvos — cada XML pode estar em vários destinos (backup, perfis...)
+    conn.execute('''CREATE TABLE IF NOT EXISTS xmls_caminhos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chave TEXT NOT NULL,
+        cnpj_cpf TEXT,
+        caminho TEXT NOT NULL,
+        tipo TEXT DEFAULT 'LOCAL',
+        perfil_nome TEXT,
+        salvo_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        UNIQUE(chave, caminho)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_xmls_caminhos_chave ON xmls_caminhos(chave)")
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS nf_status (
+        chNFe TEXT PRIMARY KEY,
+        cStat TEXT,
+        xMotivo TEXT
+    )''')
+    for tabela_nsu in ("nsu", "nsu_cte", "nsu_nfse"):
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {tabela_nsu} (
+            informante TEXT PRIMARY KEY,
+            ult_nsu TEXT
+        )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS erro_656 (
+        informante TEXT PRIMARY KEY,
+        ultimo_erro TIMESTAMP,
+        nsu_bloqueado TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS config (
+        chave TEXT PRIMARY KEY,
+        valor TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS notas_verificadas (
+        chave TEXT PRIMARY KEY,
+        verificada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        resultado TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS manifestacoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chave TEXT NOT NULL,
+        tipo_evento TEXT NOT NULL,
+        informante TEXT NOT NULL,
+        data_manifestacao TEXT NOT NULL,
+        status TEXT,
+        protocolo TEXT,
+        UNIQUE(chave, tipo_evento, informante)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_manifestacoes_chave ON manifestacoes(chave)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_manifestacoes_informante ON manifestacoes(informante)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS chaves_canceladas (
+        chave TEXT PRIMARY KEY,
+        data_cancelamento TEXT NOT NULL,
+        motivo TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        ultima_chave TEXT,
+        total_docs INTEGER,
+        docs_processados INTEGER,
+        data_inicio TEXT,
+        status TEXT
+    )''')
+
+    # 📊 Histórico de NSU — auditoria de consultas
+    conn.execute('''CREATE TABLE IF NOT EXISTS historico_nsu (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        certificado TEXT NOT NULL,
+        informante TEXT NOT NULL,
+        nsu_consultado TEXT NOT NULL,
+        data_hora_consulta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total_xmls_retornados INTEGER DEFAULT 0,
+        total_nfe INTEGER DEFAULT 0,
+        total_cte INTEGER DEFAULT 0,
+        total_nfse INTEGER DEFAULT 0,
+        total_eventos INTEGER DEFAULT 0,
+        detalhes_json TEXT,
+        status TEXT DEFAULT 'sucesso',
+        mensagem_erro TEXT,
+        tempo_processamento_ms INTEGER
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_certificado ON historico_nsu(certificado, informante, nsu_consultado)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_data ON historico_nsu(data_hora_consulta)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_informante ON historico_nsu(informante)")
+
+    # 🔒 notas_detalhadas — inclui NSU para rastreamento de documentos baixados
+    conn.execute('''CREATE TABLE IF NOT EXISTS notas_detalhadas (
+        chave TEXT PRIMARY KEY,
+        ie_tomador TEXT,
+        nome_emitente TEXT,
+        cnpj_emitente TEXT,
+        nome_destinatario TEXT,
+        cnpj_destinatario TEXT,
+        numero TEXT,
+        data_emissao TEXT,
+        tipo TEXT,
+        valor TEXT,
+        cfop TEXT,
+        vencimento TEXT,
+        ncm TEXT,
+        status TEXT DEFAULT 'Autorizado o uso da NF-e',
+        natureza TEXT,
+        uf TEXT,
+        base_icms TEXT,
+        valor_icms TEXT,
+        informante TEXT,
+        xml_status TEXT DEFAULT 'COMPLETO',
+        atualizado_em DATETIME,
+        nsu TEXT,
+        v_ibs TEXT,
+        v_cbs TEXT,
+        pdf_path TEXT,
+        pdf_tipo TEXT
+    )''')
+    _garantir_colunas(conn, "notas_detalhadas", [
+        (col, "TEXT") for col in (
+            "ie_tomador", "nome_emitente", "cnpj_emitente", "nome_destinatario",
+            "cnpj_destinatario", "numero", "data_emissao", "tipo", "valor", "cfop",
+            "vencimento", "ncm", "status", "natureza", "uf", "base_icms", "valor_icms",
+            "informante", "xml_status", "atualizado_em",
+        )
+    ] + [
+        ("nsu", "TEXT"),          # 🔒 NSU crítico para rastreamento
+        ("v_ibs", "TEXT"),        # 💰 IBS - Reforma Tributária
+        ("v_cbs", "TEXT"),        # 💰 CBS - Reforma Tributária
+        ("pdf_path", "TEXT"),     # cache do caminho do PDF
+        ("pdf_tipo", "TEXT"),     # 'OFICIAL', 'GENERICO', NULL=desconhecido
+    ])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nsu_informante ON notas_detalhadas(informante, nsu)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nsu ON notas_detalhadas(nsu)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_data_emissao ON notas_detalhadas(data_emissao)")
+
+    # Tabelas *_docs — campos completos extraídos dos XMLs (modules/xml_indexer)
+    conn.execute('''CREATE TABLE IF NOT EXISTS nfe_docs (
+        chave          TEXT PRIMARY KEY,
+        informante     TEXT,
+        caminho_xml    TEXT,
+        caminho_pdf    TEXT,
+        xml_status     TEXT,
+        -- ide
+        c_uf           TEXT,
+        nat_op         TEXT,
+        mod            TEXT,
+        serie          TEXT,
+        n_nf           TEXT,
+        dh_emi         TEXT,
+        dh_sai_ent     TEXT,
+        tp_nf          TEXT,
+        id_dest        TEXT,
+        c_mun_fg       TEXT,
+        tp_imp         TEXT,
+        tp_emis        TEXT,
+        fin_nfe        TEXT,
+        ind_final      TEXT,
+        ind_pres       TEXT,
+        -- emitente
+        emit_cnpj      TEXT,
+        emit_cpf       TEXT,
+        emit_ie        TEXT,
+        emit_xnome     TEXT,
+        emit_xfant     TEXT,
+        emit_xlgr      TEXT,
+        emit_nro       TEXT,
+        emit_xbairro   TEXT,
+        emit_cmun      TEXT,
+        emit_xmun      TEXT,
+        emit_uf        TEXT,
+        emit_cep       TEXT,
+        emit_crt       TEXT,
+        -- destinatário
+        dest_cnpj      TEXT,
+        dest_cpf       TEXT,
+        dest_ie        TEXT,
+        dest_xnome     TEXT,
+        dest_xlgr      TEXT,
+        dest_nro       TEXT,
+        dest_xbairro   TEXT,
+        dest_cmun      TEXT,
+        dest_xmun      TEXT,
+        dest_uf        TEXT,
+        dest_cep       TEXT,
+        -- totais ICMSTot
+        v_bc           TEXT,
+        v_icms         TEXT,
+        v_icms_deson   TEXT,
+        v_fcp          TEXT,
+        v_bc_st        TEXT,
+        v_st           TEXT,
+        v_fcp_st       TEXT,
+        v_prod         TEXT,
+        v_frete        TEXT,
+        v_seg          TEXT,
+        v_desc         TEXT,
+        v_ii           TEXT,
+        v_ipi          TEXT,
+        v_pis          TEXT,
+        v_cofins       TEXT,
+        v_outro        TEXT,
+        v_nf           TEXT,
+        v_tot_trib     TEXT,
+        -- IBS/CBS (Reforma Tributária)
+        v_ibs          TEXT,
+        v_cbs          TEXT,
+        v_bc_ibscbs    TEXT,
+        -- transporte
+        mod_frete      TEXT,
+        transp_cnpj    TEXT,
+        transp_xnome   TEXT,
+        -- pagamento
+        t_pag          TEXT,
+        v_pag          TEXT,
+        -- protocolo
+        n_prot         TEXT,
+        dh_recbto      TEXT,
+        c_stat         TEXT,
+        x_motivo       TEXT,
+        -- controle
+        indexado_em    TEXT
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_informante ON nfe_docs(informante)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_emit_cnpj ON nfe_docs(emit_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_dest_cnpj ON nfe_docs(dest_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfe_docs_dh_emi ON nfe_docs(dh_emi)")
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS cte_docs (
+        chave          TEXT PRIMARY KEY,
+        informante     TEXT,
+        caminho_xml    TEXT,
+        caminho_pdf    TEXT,
+        xml_status     TEXT,
+        -- ide
+        c_uf           TEXT,
+        c_ct           TEXT,
+        cfop           TEXT,
+        nat_op         TEXT,
+        mod            TEXT,
+        serie          TEXT,
+        n_ct           TEXT,
+        dh_emi         TEXT,
+        tp_imp         TEXT,
+        tp_emis        TEXT,
+        tp_amb         TEXT,
+        tp_cte         TEXT,
+        modal          TEXT,
+        tp_serv        TEXT,
+        c_mun_ini      TEXT,
+        x_mun_ini      TEXT,
+        uf_ini         TEXT,
+        c_mun_fim      TEXT,
+        x_mun_fim      TEXT,
+        uf_fim         TEXT,
+        -- emitente
+        emit_cnpj      TEXT,
+        emit_ie        TEXT,
+        emit_xnome     TEXT,
+        emit_xfant     TEXT,
+        emit_uf        TEXT,
+        emit_xmun      TEXT,
+        emit_cep       TEXT,
+        -- remetente
+        rem_cnpj       TEXT,
+        rem_cpf        TEXT,
+        rem_ie         TEXT,
+        rem_xnome      TEXT,
+        rem_uf         TEXT,
+        rem_xmun       TEXT,
+        rem_cep        TEXT,
+        -- destinatário
+        dest_cnpj      TEXT,
+        dest_cpf       TEXT,
+        dest_ie        TEXT,
+        dest_xnome     TEXT,
+        dest_uf        TEXT,
+        dest_xmun      TEXT,
+        dest_cep       TEXT,
+        -- tomador
+        tom_cnpj       TEXT,
+        tom_cpf        TEXT,
+        tom_ie         TEXT,
+        tom_xnome      TEXT,
+        -- valores prestação
+        v_tprest       TEXT,
+        v_rec          TEXT,
+        -- impostos
+        v_tot_trib     TEXT,
+        cst_icms       TEXT,
+        v_bc_icms      TEXT,
+        v_icms         TEXT,
+        -- carga
+        v_carga        TEXT,
+        pro_pred       TEXT,
+        v_carga_averb  TEXT,
+        -- NF-e vinculadas (JSON array de chaves)
+        nfe_vinculadas TEXT,
+        -- modal rodoviário
+        rntrc          TEXT,
+        veic_placa     TEXT,
+        -- protocolo
+        n_prot         TEXT,
+        dh_recbto      TEXT,
+        c_stat         TEXT,
+        x_motivo       TEXT,
+        -- controle
+        indexado_em    TEXT
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_informante ON cte_docs(informante)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_emit_cnpj ON cte_docs(emit_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_rem_cnpj ON cte_docs(rem_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_dest_cnpj ON cte_docs(dest_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cte_docs_dh_emi ON cte_docs(dh_emi)")
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS nfse_docs (
+        chave          TEXT PRIMARY KEY,
+        informante     TEXT,
+        caminho_xml    TEXT,
+        caminho_pdf    TEXT,
+        xml_status     TEXT,
+        -- identificação
+        n_nfse         TEXT,
+        n_dfse         TEXT,
+        n_dps          TEXT,
+        serie          TEXT,
+        dh_proc        TEXT,
+        dh_emi         TEXT,
+        d_compet       TEXT,
+        c_stat         TEXT,
+        x_motivo       TEXT,
+        tp_emis        TEXT,
+        tp_amb         TEXT,
+        ver_aplic      TEXT,
+        -- localização
+        c_loc_incid    TEXT,
+        x_loc_incid    TEXT,
+        x_trib_nac     TEXT,
+        x_trib_mun     TEXT,
+        x_nbs          TEXT,
+        c_loc_prestacao TEXT,
+        -- prestador (emitente)
+        prest_cnpj     TEXT,
+        prest_cpf      TEXT,
+        prest_im       TEXT,
+        prest_xnome    TEXT,
+        prest_xfant    TEXT,
+        prest_cmun     TEXT,
+        prest_uf       TEXT,
+        prest_cep      TEXT,
+        prest_email    TEXT,
+        -- regime tributário
+        op_simp_nac    TEXT,
+        reg_esp_trib   TEXT,
+        -- tomador
+        tom_cnpj       TEXT,
+        tom_cpf        TEXT,
+        tom_xnome      TEXT,
+        tom_cmun       TEXT,
+        tom_uf         TEXT,
+        tom_cep        TEXT,
+        tom_email      TEXT,
+        -- serviço
+        c_trib_nac     TEXT,
+        c_trib_mun     TEXT,
+        x_desc_serv    TEXT,
+        c_nbs          TEXT,
+        -- valores
+        v_serv         TEXT,
+        v_bc           TEXT,
+        p_aliq         TEXT,
+        v_issqn        TEXT,
+        v_total_ret    TEXT,
+        v_liq          TEXT,
+        v_calc_dr      TEXT,
+        -- controle
+        indexado_em    TEXT
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_informante ON nfse_docs(informante)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_prest_cnpj ON nfse_docs(prest_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_tom_cnpj ON nfse_docs(tom_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfse_docs_dh_emi ON nfse_docs(dh_emi)")
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS nfce_docs (
+        chave          TEXT PRIMARY KEY,
+        informante     TEXT,
+        caminho_xml    TEXT,
+        caminho_pdf    TEXT,
+        xml_status     TEXT,
+        -- identificação
+        c_uf           TEXT,
+        nat_op         TEXT,
+        mod            TEXT,
+        serie          TEXT,
+        n_nf           TEXT,
+        dh_emi         TEXT,
+        tp_nf          TEXT,
+        c_mun_fg       TEXT,
+        tp_emis        TEXT,
+        fin_nfe        TEXT,
+        -- emitente
+        emit_cnpj      TEXT,
+        emit_cpf       TEXT,
+        emit_ie        TEXT,
+        emit_xnome     TEXT,
+        emit_xfant     TEXT,
+        emit_xlgr      TEXT,
+        emit_nro       TEXT,
+        emit_xbairro   TEXT,
+        emit_cmun      TEXT,
+        emit_xmun      TEXT,
+        emit_uf        TEXT,
+        emit_cep       TEXT,
+        emit_crt       TEXT,
+        -- destinatário (opcional na NFC-e)
+        dest_cnpj      TEXT,
+        dest_cpf       TEXT,
+        dest_xnome     TEXT,
+        -- produtos (JSON array)
+        produtos       TEXT,
+        qt_itens       INTEGER,
+        -- totais ICMSTot
+        v_prod         TEXT,
+        v_desc         TEXT,
+        v_frete        TEXT,
+        v_seg          TEXT,
+        v_outro        TEXT,
+        v_pis          TEXT,
+        v_cofins       TEXT,
+        v_nf           TEXT,
+        v_bc           TEXT,
+        v_icms         TEXT,
+        v_icms_deson   TEXT,
+        v_tot_trib     TEXT,
+        -- pagamento
+        t_pag          TEXT,
+        v_pag          TEXT,
+        v_troco        TEXT,
+        -- QR Code / suplementar
+        qr_code        TEXT,
+        url_chave      TEXT,
+        -- protocolo
+        n_prot         TEXT,
+        dh_recbto      TEXT,
+        c_stat         TEXT,
+        x_motivo       TEXT,
+        -- controle
+        indexado_em    TEXT
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfce_docs_informante ON nfce_docs(informante)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfce_docs_emit_cnpj ON nfce_docs(emit_cnpj)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nfce_docs_dh_emi ON nfce_docs(dh_emi)")
+
+
+def _m002_reparo_destinatario_nfse(conn: sqlite3.Connection):
+    """Preenche nome_destinatario em NFS-e ADN que foram salvas sem esse campo."""
+    conn.execute("""
+        UPDATE notas_detalhadas
+        SET nome_destinatario = (
+            SELECT d.tom_xnome FROM nfse_docs d
+            WHERE d.prest_cnpj = notas_detalhadas.cnpj_emitente
+              AND d.n_nfse = notas_detalhadas.numero
+              AND d.tom_xnome IS NOT NULL AND d.tom_xnome != ''
+            LIMIT 1
+        )
+        WHERE tipo = 'NFS-e'
+          AND (nome_destinatario IS NULL OR nome_destinatario = '')
+          AND EXISTS (
+            SELECT 1 FROM nfse_docs d
+            WHERE d.prest_cnpj = notas_detalhadas.cnpj_emitente
+              AND d.n_nfse = notas_detalhadas.numero
+              AND d.tom_xnome IS NOT NULL AND d.tom_xnome != ''
+          )
+    """)
+
+
+def _m003_colunas_normalizadas(conn: sqlite3.Connection):
+    """Centavos/data ISO/epoch em notas_detalhadas, mantidos por gatilhos."""
+    from .colunas_normalizadas import criar_colunas_e_gatilhos
+    criar_colunas_e_gatilhos(conn)
+
+
+def _m004_feed_alteracoes(conn: sqlite3.Connection):
+    """
+    Sequência de alterações de notas_detalhadas para a interface carregar só
+    o delta: todo INSERT/UPDATE recebe alteracao_seq crescente e cada DELETE
+    deixa uma lápide em notas_removidas.
+    """
+    _garantir_colunas(conn, "notas_detalhadas", [("alteracao_seq", "INTEGER")])
+    conn.execute('''CREATE TABLE IF NOT EXISTS sequencia_alteracoes (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        ultimo INTEGER NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS notas_removidas (
+        chave TEXT PRIMARY KEY,
+        alteracao_seq INTEGER NOT NULL,
+        removida_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+    )''')
+    # Linhas existentes entram na ordem de rowid
+    conn.execute("UPDATE notas_detalhadas SET alteracao_seq = rowid WHERE alteracao_seq IS NULL")
+    conn.execute("INSERT OR REPLACE INTO sequencia_alteracoes (id, ultimo) "
+                 "SELECT 1, COALESCE(MAX(alteracao_seq), 0) FROM notas_detalhadas")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_alteracao_seq ON notas_detalhadas(alteracao_seq)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_removidas_seq ON notas_removidas(alteracao_seq)")
+
+    proximo = ("UPDATE sequencia_alteracoes SET ultimo = ultimo + 1 WHERE id = 1;")
+    atual = "(SELECT ultimo FROM sequencia_alteracoes WHERE id = 1)"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_notas_seq_ins AFTER INSERT ON notas_detalhadas
+        BEGIN
+            {proximo}
+            UPDATE notas_detalhadas SET alteracao_seq = {atual} WHERE rowid = NEW.rowid;
+            DELETE FROM notas_removidas WHERE chave = NEW.chave;
+        END
+    """)
+    # WHEN evita que a própria atribuição de alteracao_seq gere novo número
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_notas_seq_upd AFTER UPDATE ON notas_detalhadas
+        WHEN NEW.alteracao_seq IS OLD.alteracao_seq
+        BEGIN
+            {proximo}
+            UPDATE notas_detalhadas SET alteracao_seq = {atual} WHERE rowid = NEW.rowid;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_notas_seq_del AFTER DELETE ON notas_detalhadas
+        BEGIN
+            {proximo}
+            INSERT OR REPLACE INTO notas_removidas (chave, alteracao_seq) VALUES (OLD.chave, {atual});
+        END
+    """)
+
+
+def _m005_abrasf_incremental(conn: sqlite3.Connection):
+    """
+    Consulta ABRASF incremental: watermark de data por (CNPJ, provedor,
+    município) e índice das notas já recebidas por (município, prestador,
+    número) — permite descartar a nota antes de qualquer parse/gravação.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS nfse_abrasf_watermark (
+        cnpj TEXT NOT NULL,
+        provedor TEXT NOT NULL,
+        codigo_municipio TEXT NOT NULL,
+        ultima_data TEXT NOT NULL,
+        atualizado_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        PRIMARY KEY (cnpj, provedor, codigo_municipio)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS nfse_abrasf_vistas (
+        codigo_municipio TEXT NOT NULL,
+        cnpj_prestador TEXT NOT NULL,
+        numero TEXT NOT NULL,
+        vista_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        PRIMARY KEY (codigo_municipio, cnpj_prestador, numero)
+    ) WITHOUT ROWID''')
+
+
+def _m006_agenda_status(conn: sqlite3.Connection):
+    """last_checked/next_check por chave para a consulta de eventos."""
+    from .agenda_status import criar_tabela
+    criar_tabela(conn)
+
+
+def _m007_fila_offline(conn: sqlite3.Connection):
+    """Pedidos à SEFAZ feitos sem conexão, refeitos quando ela volta."""
+    from .fila_offline import criar_tabela
+    criar_tabela(conn)
+
+
+def _m008_resumos_download(conn: sqlite3.Connection):
+    """Agenda de novas tentativas das NF-e que ficaram INDISPONIVEL."""
+    from .download_resumos import criar_tabela
+    criar_tabela(conn)
+
+
+def _m009_eventos_index(conn: sqlite3.Connection):
+    """Índice de eventos por chave/tpEvento/nSeqEvento (substitui a varredura das pastas Eventos/)."""
+    from .eventos_index import criar_tabela
+    criar_tabela(conn)
+
+
+def _m010_doc_links(conn: sqlite3.Connection):
+    """Vínculos entre documentos (CT-e → NF-e, NFref, eventos de CT-e/MDF-e)."""
+    from .doc_links import criar_tabela
+    criar_tabela(conn)
+
+
+def _m011_nfe_itens(conn: sqlite3.Connection):
+    """Itens (det/prod + imposto) das NF-e/NFC-e, tipados e indexados por NCM, CFOP e emitente."""
+    from .nfe_itens import criar_tabela
+    criar_tabela(conn)
+
+
+def _m012_pdf_especulativo(conn: sqlite3.Connection):
+    """PDFs pré-gerados em segundo plano, com o tamanho de cada um (orçamento de disco)."""
+    from .pdf_especulativo import criar_tabela
+    criar_tabela(conn)
+
+
+
+# (versao, descricao, funcao) — SEMPRE acrescente no final
+MIGRACOES: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "esquema base (certificados, xmls, nsu, notas_detalhadas, *_docs)", _m001_esquema_base),
+    (2, "reparo nome_destinatario em NFS-e ADN", _m002_reparo_destinatario_nfse),
+    (3, "colunas normalizadas (centavos, data ISO, epoch) em notas_detalhadas", _m003_colunas_normalizadas),
+    (4, "sequência de alterações e lápides de notas_detalhadas", _m004_feed_alteracoes),
+    (5, "watermark e notas vistas da consulta ABRASF municipal", _m005_abrasf_incremental),
+    (6, "agenda de verificação de eventos por chave", _m006_agenda_status),
+    (7, "fila persistente de requisições feitas offline", _m007_fila_offline),
+    (8, "agenda de download das NF-e resumo/indisponíveis", _m008_resumos_download),
+    (9, "índice de eventos por chave/tpEvento/nSeqEvento", _m009_eventos_index),
+    (10, "vínculos entre documentos (doc_links)", _m010_doc_links),
+    (11, "itens das NF-e (nfe_itens)", _m011_nfe_itens),
+    (12, "PDFs pré-gerados e seus tamanhos (pdf_especulativo)", _m012_pdf_especulativo),
+]
+
+VERSAO_ESQUEMA = MIGRACOES[-1][0]
+
+
+# ---------------------------------------------------------------------------
+# API
+# ---------------------------------------------------------------------------
+
+def versao_atual(conn: sqlite3.Connection) -> int:
+    """Versão registrada em schema_version (0 se o banco ainda não é versionado)."""
+    try:
+        row = conn.execute("SELECT MAX(versao) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row[0] or 0)
+
+
+def aplicar_migracoes(db_path: Union[str, Path], forcar: bool = False) -> int:
+    """
+    Aplica as migrações pendentes e devolve a versão final do esquema.
+
+    Na primeira chamada do processo faz uma única consulta em schema_version;
+    se o banco já está na versão corrente, nenhuma DDL é executada. As chamadas
+    seguintes para o mesmo banco retornam direto do cache (sem abrir conexão),
+    a menos que `forcar=True`.
+    """
+    chave = str(Path(db_path).resolve())
+    if not forcar and chave in _bancos_migrados:
+        return VERSAO_ESQUEMA
+
+    with _lock:
+        if not forcar and chave in _bancos_migrados:
+            return VERSAO_ESQUEMA
+        conn = sqlite3.connect(str(db_path), timeout=30, isolation_level=None)
+        try:
+            versao = versao_atual(conn)
+            if versao < VERSAO_ESQUEMA:
+                # BEGIN IMMEDIATE: outro processo migrando espera aqui e, ao
+                # entrar, relê a versão para não reaplicar nada.
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                        versao INTEGER PRIMARY KEY,
+                        descricao TEXT,
+                        aplicada_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+                    )''')
+                    versao = versao_atual(conn)
+                    for numero, descricao, funcao in MIGRACOES:
+                        if numero <= versao:
+                            continue
+                        print(f"[MIGRAÇÃO] v{numero}: {descricao}")
+                        funcao(conn)
+                        conn.execute("INSERT INTO schema_version (versao, descricao) VALUES (?, ?)",
+                                     (numero, descricao))
+                        versao = numero
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        finally:
+            conn.close()
+        _bancos_migrados.add(chave)
+        return versao
+
+
+def esquecer_cache(db_path: Optional[Union[str, Path]] = None):
+    """Remove o banco (ou todos) do cache de migrados — útil em testes/restauração de backup."""
+    with _lock:
+        if db_path is None:
+            _bancos_migrados.clear()
+        else:
+            _bancos_migrados.discard(str(Path(db_path).resolve()))
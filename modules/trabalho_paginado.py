@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Base dos trabalhos longos em segundo plano (Gerenciador de Trabalhos).
+
+    - Trabalho: pausar/retomar/cancelar vindos de outra thread (a interface);
+    - ler_config()/marcado()/marcar(): marcas e checkpoints na tabela config;
+    - TrabalhoPaginado: percorre uma consulta SQL de notas pendentes em
+      páginas por rowid, localiza os XMLs em lote (localizar_em_lote:
+      xmls_caminhos, xmls_baixados, arquivo mensal; a varredura de pastas
+      só acontece uma vez, e só para o que o banco não achou), extrai num
+      pool de processos e grava uma transação por página junto com o
+      checkpoint (último rowid). Cancelado ou interrompido, continua de onde
+      parou; concluído, apaga o checkpoint e marca CHAVE_CONCLUIDO.
+
+A subclasse informa só o que é dela — a consulta, o extrator (função de
+módulo, para poder ir ao pool) e a gravação da página:
+
+    class PreencherAlgo(TrabalhoPaginado):
+        ROTULO = '💰 [ALGO]'
+        SQL_PENDENTES = "SELECT rowid, chave FROM notas_detalhadas WHERE rowid > ? ... ORDER BY rowid"
+        CHAVE_CHECKPOINT = 'algo_rowid'
+        extrair = staticmethod(extrair_algo)         # (bytes do XML, chave) → resultado
+
+        def gravar(self, conn, resultados, stats):   # [(chave, resultado)] da página
+            conn.executemany(...)
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from modules.arquivo_mensal import ler_bytes
+from modules.exportacao_lote import localizar_em_lote
+
+logger = logging.getLogger('nfe_search')
+
+LOTE_DB = 2000              # notas por página (uma transação e um checkpoint por página)
+
+OK = 'ok'
+NAO_ENCONTRADO = 'nao_encontrado'
+ERRO = 'erro'
+
+_RE_CHAVE = re.compile(r'\d{44}')
+
+
+# ---------------------------------------------------------------------------
+# Marcas em config
+# ---------------------------------------------------------------------------
+
+def ler_config(conn: sqlite3.Connection, chave: str) -> Optional[str]:
+    try:
+        row = conn.execute("SELECT valor FROM config WHERE chave = ?", (chave,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def marcado(conn: sqlite3.Connection, chave: str) -> bool:
+    return bool(ler_config(conn, chave))
+
+
+def marcar(conn: sqlite3.Connection, chave: str, valor: Optional[str] = None):
+    """Grava a marca (por padrão, o instante atual)."""
+    conn.execute("INSERT OR REPLACE INTO config (chave, valor) VALUES (?, ?)",
+                 (chave, valor if valor is not None else time.strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def ler_checkpoint(conn: sqlite3.Connection, chave: str) -> int:
+    try:
+        return int(ler_config(conn, chave) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+# ---------------------------------------------------------------------------
+# Localização e extração
+# ---------------------------------------------------------------------------
+
+def indexar_pasta(pasta: Union[str, Path]) -> Dict[str, str]:
+    """chave → XML numa varredura só (prefere o arquivo cujo nome é exatamente a chave)."""
+    indice: Dict[str, str] = {}
+    pendentes = [str(pasta)]
+    while pendentes:
+        try:
+            entradas = list(os.scandir(pendentes.pop()))
+        except OSError:
+            continue
+        for entrada in entradas:
+            if entrada.is_dir(follow_symlinks=False):
+                pendentes.append(entrada.path)
+            elif entrada.name.lower().endswith('.xml'):
+                m = _RE_CHAVE.search(entrada.name)
+                if not m:
+                    continue
+                if entrada.name[:-4] == m.group(0):
+                    indice[m.group(0)] = entrada.path
+                else:
+                    indice.setdefault(m.group(0), entrada.path)
+    return indice
+
+
+def processar(extrair: Callable[[bytes, str], Any],
+              itens: Sequence[Tuple[str, Sequence[str]]]) -> List[Tuple[str, Any, str]]:
+    """Roda no pool: (chave, caminhos candidatos) → (chave, extrair(xml, chave), situação)."""
+    resultados = []
+    for chave, candidatos in itens:
+        dados = None
+        for caminho in candidatos:
+            dados = ler_bytes(caminho)
+            if dados:
+                break
+        if not dados:
+            resultados.append((chave, None, NAO_ENCONTRADO))
+            continue
+        try:
+            resultados.append((chave, extrair(dados, chave), OK))
+        except Exception as e:
+            resultados.append((chave, None, f"{ERRO}: {type(e).__name__}: {e}"))
+    return resultados
+
+
+# ---------------------------------------------------------------------------
+# Trabalhos
+# ---------------------------------------------------------------------------
+
+class Trabalho:
+    """pausar/retomar/cancelar podem vir de outra thread; o laço chama aguardar() entre lotes."""
+
+    def __init__(self):
+        self._cancelado = threading.Event()
+        self._rodando = threading.Event()
+        self._rodando.set()
+
+    def pausar(self):
+        self._rodando.clear()
+
+    def retomar(self):
+        self._rodando.set()
+
+    def cancelar(self):
+        self._cancelado.set()
+        self._rodando.set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self._cancelado.is_set()
+
+    def aguardar(self) -> bool:
+        """Bloqueia enquanto pausado; False se o trabalho foi cancelado."""
+        self._rodando.wait()
+        return not self.cancelado
+
+
+class TrabalhoPaginado(Trabalho):
+    ROTULO = '⚙️ [TRABALHO]'
+    SQL_PENDENTES = ''                        # SELECT rowid, chave ... WHERE rowid > ? ... ORDER BY rowid
+    CHAVE_CHECKPOINT = ''
+    CHAVE_CONCLUIDO: Optional[str] = None
+    LOTE_PROCESSO = 200                       # notas por tarefa enviada ao pool
+    MINIMO_POOL = 400                         # abaixo disso o custo de subir processos não compensa
+    extrair: Callable[[bytes, str], Any]
+
+    def __init__(self, db_path: Union[str, Path], pasta_xmls: Optional[Union[str, Path]] = None,
+                 processos: Optional[int] = None, lote: int = LOTE_DB, recomecar: bool = False):
+        super().__init__()
+        self.db_path = str(db_path)
+        self.pasta_xmls = pasta_xmls
+        self.processos = max(1, processos or os.cpu_count() or 1)
+        self.lote = max(1, lote)
+        self.recomecar = recomecar
+        self._indice_pasta: Optional[Dict[str, str]] = None
+
+    # --- pontos de extensão -------------------------------------------------
+
+    def estatisticas(self) -> Dict:
+        """Contadores próprios da subclasse, somados aos comuns."""
+        return {}
+
+    def gravar(self, conn: sqlite3.Connection, resultados: List[Tuple[str, Any]], stats: Dict):
+        """Grava os resultados extraídos da página (dentro da transação do checkpoint)."""
+        raise NotImplementedError
+
+    def resumo(self, stats: Dict) -> str:
+        return ''
+
+    # ------------------------------------------------------------------------
+
+    @classmethod
+    def contar_pendentes(cls, conn: sqlite3.Connection, desde_rowid: int = 0) -> int:
+        return conn.execute(f"SELECT COUNT(*) FROM ({cls.SQL_PENDENTES})", (desde_rowid,)).fetchone()[0]
+
+    def _extrair(self, pool, itens) -> List[Tuple[str, Any, str]]:
+        """Resultados na ordem dos itens; cancelado no meio, devolve só o prefixo pronto."""
+        tarefas = [itens[i:i + self.LOTE_PROCESSO] for i in range(0, len(itens), self.LOTE_PROCESSO)]
+        if pool is None:
+            resultados = []
+            for tarefa in tarefas:
+                if self.cancelado:
+                    break
+                resultados.extend(processar(self.extrair, tarefa))
+            return resultados
+        futuros = [pool.submit(processar, self.extrair, tarefa) for tarefa in tarefas]
+        resultados = []
+        try:
+            for futuro, tarefa in zip(futuros, tarefas):
+                if self.cancelado:
+                    break
+                try:
+                    resultados.extend(futuro.result())
+                except Exception as e:  # processo morto (BrokenProcessPool) etc.
+                    resultados.extend((chave, None, f"{ERRO}: {type(e).__name__}: {e}") for chave, _ in tarefa)
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+        return resultados
+
+    def _pela_pasta(self, chaves: List[str]) -> List[Tuple[str, List[str]]]:
+        if not self.pasta_xmls:
+            return []
+        if self._indice_pasta is None:
+            inicio = time.monotonic()
+            self._indice_pasta = indexar_pasta(self.pasta_xmls)
+            logger.info(f"{self.ROTULO} Pasta indexada: {len(self._indice_pasta)} XML(s) "
+                        f"em {time.monotonic() - inicio:.1f}s")
+        return [(c, [self._indice_pasta[c]]) for c in chaves if c in self._indice_pasta]
+
+    def _abrir_pool(self, total: int):
+        if self.processos == 1 or total < self.MINIMO_POOL:
+            return None
+        try:
+            return ProcessPoolExecutor(max_workers=self.processos)
+        except (OSError, NotImplementedError) as e:
+            logger.warning(f"⚠️ {self.ROTULO} Pool de processos indisponível ({e}) — extraindo no processo atual")
+            return None
+
+    def executar(self, progresso: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """
+        Processa as notas pendentes a partir do checkpoint. `progresso(feitos,
+        total, stats)` é chamado a cada página. Retorna as estatísticas.
+        """
+        stats = {'processadas': 0, 'total': 0, 'nao_encontradas': 0, 'erros': 0, **self.estatisticas(),
+                 'cancelado': False, 'segundos': 0.0}
+        inicio = time.monotonic()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        pool = None
+        try:
+            ultimo = 0 if self.recomecar else ler_checkpoint(conn, self.CHAVE_CHECKPOINT)
+            stats['total'] = total = self.contar_pendentes(conn, ultimo)
+            if ultimo:
+                logger.info(f"{self.ROTULO} Retomando do checkpoint (rowid {ultimo}): {total} nota(s) pendente(s)")
+            pool = self._abrir_pool(total)
+            if pool is not None:
+                logger.info(f"{self.ROTULO} {total} nota(s) em {self.processos} processo(s)")
+
+            while self.aguardar():
+                pagina = conn.execute(f"{self.SQL_PENDENTES} LIMIT ?", (ultimo, self.lote)).fetchall()
+                if not pagina:
+                    break
+
+                docs = localizar_em_lote(conn, [chave for _, chave in pagina])
+                resultados = self._extrair(pool, [(chave, docs[chave].xmls if chave in docs else [])
+                                                  for _, chave in pagina])
+                if len(resultados) < len(pagina):   # cancelado no meio da página
+                    pagina = pagina[:len(resultados)]
+                    if not pagina:
+                        break
+
+                # Não achou pelo banco (sem caminho ou arquivo sumiu): uma varredura de pastas só
+                faltando = [r[0] for r in resultados if r[2] == NAO_ENCONTRADO]
+                if faltando:
+                    novos = {r[0]: r for r in processar(self.extrair, self._pela_pasta(faltando))}
+                    resultados = [novos.get(r[0], r) for r in resultados]
+
+                prontos = []
+                for chave, resultado, situacao in resultados:
+                    if situacao == OK:
+                        prontos.append((chave, resultado))
+                    elif situacao == NAO_ENCONTRADO:
+                        stats['nao_encontradas'] += 1
+                    else:
+                        stats['erros'] += 1
+                        logger.debug(f"{self.ROTULO} {chave}: {situacao}")
+
+                ultimo = pagina[-1][0]
+                with conn:
+                    self.gravar(conn, prontos, stats)
+                    marcar(conn, self.CHAVE_CHECKPOINT, str(ultimo))
+                stats['processadas'] += len(pagina)
+                if progresso:
+                    progresso(stats['processadas'], total, dict(stats))
+
+            stats['cancelado'] = self.cancelado
+            if not self.cancelado:
+                with conn:
+                    conn.execute("DELETE FROM config WHERE chave = ?", (self.CHAVE_CHECKPOINT,))
+                    if self.CHAVE_CONCLUIDO:
+                        marcar(conn, self.CHAVE_CONCLUIDO)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            conn.close()
+
+        stats['segundos'] = round(time.monotonic() - inicio, 1)
+        proprio = self.resumo(stats)
+        logger.info(
+            f"{self.ROTULO} {'Interrompido' if stats['cancelado'] else 'Concluído'}: "
+            f"{stats['processadas']}/{stats['total']} nota(s) | {proprio + ' | ' if proprio else ''}"
+            f"⚠️ {stats['nao_encontradas']} sem XML | ❌ {stats['erros']} erro(s) | {stats['segundos']}s"
+        )
+        return stats
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Cache persistente dos documentos WSDL/XSD usados pelo zeep.
+
+_get_cached_wsdl_client guardava o Client só em memória: cada processo novo
+(interface, subprocesso do sandbox, scripts) baixava e interpretava de novo
+os WSDLs da Distribuição DFe e da Consulta Protocolo — até 60 s x 2
+tentativas antes de fazer qualquer coisa, e nada funcionava sem rede.
+
+CacheDocumentos implementa a interface de cache do zeep (get/add) sobre um
+SQLite em <dados>/cache/wsdl_cache.db. O zeep passa por ele em TODO
+documento que carrega (WSDL e XSDs importados), então com o cache quente a
+construção do Client não toca a rede.
+
+Documentos embarcados: Arquivo_wsdl/manifesto.json (gerado por
+scripts/atualizar_wsdl_embarcado.py antes de cada release) lista url →
+arquivo + sha256. Na primeira execução o cache é semeado com eles, e a
+instalação nova funciona offline.
+
+Revalidação: documentos com mais de REVALIDAR_APOS são baixados de novo em
+uma thread de fundo (com a sessão mTLS de quem pediu); se mudaram, o cache
+é atualizado e `ao_mudar(url)` é chamado para descartar o Client em memória.
+
+Uso:
+    from modules.wsdl_cache import cache_documentos, revalidar_em_segundo_plano
+
+    transport.cache = cache_documentos()
+    client = Client(wsdl=url, transport=transport)
+    revalidar_em_segundo_plano(transport.session)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+logger = logging.getLogger('nfe_search')
+
+REVALIDAR_APOS = 7 * 24 * 3600     # segundos
+TIMEOUT_REVALIDACAO = 30
+PASTA_EMBARCADA = 'Arquivo_wsdl'
+MANIFESTO = 'manifesto.json'
+
+
+def _diretorio_app() -> Path:
+    """Pasta dos recursos embarcados (PyInstaller extrai em sys._MEIPASS)."""
+    if getattr(sys, 'frozen', False):
+        return Path(getattr(sys, '_MEIPASS', Path(sys.executable).parent))
+    return Path(__file__).resolve().parent.parent
+
+
+def _diretorio_dados() -> Path:
+    if getattr(sys, 'frozen', False):
+        return Path(os.environ.get('APPDATA', Path.home())) / "Busca XML"
+    return Path(__file__).resolve().parent.parent
+
+
+def _sha256(conteudo: bytes) -> str:
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+class CacheDocumentos:
+    """Documentos por URL em SQLite (interface zeep.cache.Base: get/add)."""
+
+    def __init__(self, caminho: Path, relogio: Callable[[], float] = time.time):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._relogio = relogio
+        self._lock = threading.Lock()
+        with self._conectar() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS documentos (
+                url TEXT PRIMARY KEY,
+                conteudo BLOB NOT NULL,
+                sha256 TEXT NOT NULL,
+                obtido_em REAL NOT NULL,
+                origem TEXT NOT NULL DEFAULT 'rede'
+            )''')
+
+    def _conectar(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.caminho), timeout=10)
+
+    # Interface do zeep -------------------------------------------------
+
+    def get(self, url: str) -> Optional[bytes]:
+        with self._lock, self._conectar() as conn:
+            row = conn.execute("SELECT conteudo FROM documentos WHERE url = ?", (url,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def add(self, url: str, content) -> None:
+        self.gravar(url, content, origem='rede')
+
+    # ------------------------------------------------------------------
+
+    def gravar(self, url: str, content, origem: str = 'rede') -> bool:
+        """Grava/atualiza; retorna True se o conteúdo mudou."""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        digest = _sha256(content)
+        with self._lock, self._conectar() as conn:
+            row = conn.execute("SELECT sha256 FROM documentos WHERE url = ?", (url,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO documentos (url, conteudo, sha256, obtido_em, origem) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, sqlite3.Binary(content), digest, self._relogio(), origem)
+            )
+        return row is None or row[0] != digest
+
+    def urls(self) -> List[str]:
+        with self._lock, self._conectar() as conn:
+            return [r[0] for r in conn.execute("SELECT url FROM documentos ORDER BY url")]
+
+    def vencidos(self, max_idade: float = REVALIDAR_APOS) -> List[str]:
+        limite = self._relogio() - max_idade
+        with self._lock, self._conectar() as conn:
+            return [r[0] for r in conn.execute(
+                "SELECT url FROM documentos WHERE obtido_em <= ? ORDER BY obtido_em", (limite,))]
+
+    def semear(self, pasta: Path) -> int:
+        """Copia para o cache os documentos embarcados que ainda não estão nele."""
+        manifesto = Path(pasta) / MANIFESTO
+        if not manifesto.exists():
+            return 0
+        try:
+            dados = json.loads(manifesto.read_text(encoding='utf-8'))
+        except Exception as e:
+            logger.warning(f"⚠️ [WSDL] Manifesto inválido em {manifesto}: {e}")
+            return 0
+        existentes = set(self.urls())
+        total = 0
+        for url, info in (dados.get('documentos') or {}).items():
+            if url in existentes:
+                continue
+            arquivo = Path(pasta) / info.get('arquivo', '')
+            try:
+                conteudo = arquivo.read_bytes()
+            except OSError:
+                continue
+            if info.get('sha256') and _sha256(conteudo) != info['sha256']:
+                logger.warning(f"⚠️ [WSDL] {arquivo.name} não confere com o manifesto — ignorado")
+                continue
+            self.gravar(url, conteudo, origem='embarcado')
+            # Embarcado conta como "obtido" na data do manifesto: revalida cedo se a release for antiga
+            with self._lock, self._conectar() as conn:
+                conn.execute("UPDATE documentos SET obtido_em = ? WHERE url = ?",
+                             (float(dados.get('gerado_em_epoch') or 0), url))
+            total += 1
+        if total:
+            logger.info(f"📦 [WSDL] {total} documento(s) embarcado(s) (versão {dados.get('versao', '?')}) no cache")
+        return total
+
+    def exportar(self, pasta: Path, versao: str) -> int:
+        """Grava os documentos do cache + manifesto em `pasta` (usado pelo script de release)."""
+        pasta = Path(pasta)
+        pasta.mkdir(parents=True, exist_ok=True)
+        documentos = {}
+        with self._lock, self._conectar() as conn:
+            rows = conn.execute("SELECT url, conteudo, sha256 FROM documentos ORDER BY url").fetchall()
+        for url, conteudo, digest in rows:
+            nome = f"{digest[:16]}.xml"
+            (pasta / nome).write_bytes(bytes(conteudo))
+            documentos[url] = {'arquivo': nome, 'sha256': digest}
+        (pasta / MANIFESTO).write_text(json.dumps({
+            'versao': versao,
+            'gerado_em_epoch': int(self._relogio()),
+            'documentos': documentos,
+        }, indent=2, ensure_ascii=False), encoding='utf-8')
+        return len(documentos)
+
+
+_cache: Optional[CacheDocumentos] = None
+_cache_lock = threading.Lock()
+_revalidados = set()
+_ao_mudar: List[Callable[[str], None]] = []
+
+
+def cache_documentos() -> CacheDocumentos:
+    """Cache único do processo, semeado com os documentos embarcados na primeira chamada."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheDocumentos(_diretorio_dados() / "cache" / "wsdl_cache.db")
+            try:
+                _cache.semear(_diretorio_app() / PASTA_EMBARCADA)
+            except Exception as e:
+                logger.warning(f"⚠️ [WSDL] Falha ao semear cache embarcado: {e}")
+        return _cache
+
+
+def ao_mudar(callback: Callable[[str], None]):
+    """Registra callback(url) chamado quando a revalidação encontra documento novo."""
+    if callback not in _ao_mudar:
+        _ao_mudar.append(callback)
+
+
+def revalidar(sessao, cache: CacheDocumentos, urls: Iterable[str],
+              timeout: float = TIMEOUT_REVALIDACAO) -> List[str]:
+    """Baixa de novo cada URL; retorna as que mudaram. Falha de rede mantém o documento."""
+    mudaram = []
+    for url in urls:
+        try:
+            resp = sessao.get(url, timeout=timeout)
+            resp.raise_for_status()
+            conteudo = resp.content
+        except Exception as e:
+            logger.debug(f"[WSDL] Revalidação adiada para {url[:80]}: {e}")
+            continue
+        if not conteudo:
+            continue
+        if cache.gravar(url, conteudo, origem='rede'):
+            mudaram.append(url)
+            logger.info(f"🔄 [WSDL] Documento atualizado pela SEFAZ: {url[:80]}")
+            for callback in list(_ao_mudar):
+                try:
+                    callback(url)
+                except Exception:
+                    pass
+    return mudaram
+
+
+def revalidar_em_segundo_plano(sessao, max_idade: float = REVALIDAR_APOS) -> Optional[threading.Thread]:
+    """Dispara (uma vez por URL e processo) a revalidação dos documentos vencidos."""
+    cache = cache_documentos()
+    with _cache_lock:
+        urls = [u for u in cache.vencidos(max_idade) if u not in _revalidados]
+        _revalidados.update(urls)
+    if not urls:
+        return None
+    t = threading.Thread(target=revalidar, args=(sessao, cache, urls),
+                         name="wsdl-revalidacao", daemon=True)
+    t.start()
+    return t
@@ -26,6 +26,8 @@ except ImportError:
     import xml.etree.ElementTree as ET  # type: ignore
     _LXML = False
 
+from modules.doc_links import vinculos_da_arvore
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -258,6 +260,9 @@ def parse_nfe(xml_path: str, informante: str = "") -> Dict[str, Any]:
             "x_motivo": _t(inf_prot, "nfe:xMotivo", ns),
         })
 
+    # documentos referenciados (NFref) — gravados em doc_links pela ingestão
+    data["vinculos"] = vinculos_da_arvore(root)
+
     return data
 
 
@@ -459,6 +464,9 @@ def parse_cte(xml_path: str, informante: str = "") -> Dict[str, Any]:
                 "x_motivo": _t(inf_prot, "cte:xMotivo", ns),
             })
 
+    # NF-e transportadas, CT-e complementado/substituído/anterior — gravados em doc_links
+    data["vinculos"] = vinculos_da_arvore(root)
+
     return data
 
 
@@ -23,6 +23,9 @@ from zeep.transports import Transport
 from zeep.exceptions import Fault
 from lxml import etree
 
+from modules.saude_endpoints import registro_compartilhado as saude_endpoints
+from modules.fila_offline import Adiar, ReprodutorFila, Rejeitada, enfileirar, erro_de_rede
+
 # Importa sistema de criptografia
 try:
     from modules.crypto_portable import get_portable_crypto
@@ -162,7 +165,9 @@ def ciclo_nsu(db, parser, intervalo=3600):
     - NSU = 0 automático para primeira consulta
     - Retry exponencial (5s → 15s → 60s → 5min)
     - Modo investigação após 5 falhas consecutivas
-    - Detecção de estado offline
+    - Detecção de estado offline (sonda a SEFAZ e, quando ela volta, refaz só
+      os certificados que a queda interrompeu; os demais seguem o intervalo)
+    - Fila offline: pedidos feitos sem conexão são refeitos no início do ciclo
     """
     BASE_DIR = get_data_dir()
     XML_DIR = BASE_DIR / "xmls"
@@ -175,13 +180,25 @@ def ciclo_nsu(db, parser, intervalo=3600):
     # Estado global
     estado_offline = False
     falhas_consecutivas = {}
+    cortados_offline = set()  # informantes que a falta de conexão interrompeu no ciclo
     
     while True:
         try:
-            logger.info(f"Iniciando busca periódica de NSU em {datetime.now().isoformat()}")
             certificados = db.get_certificados()
+            if cortados_offline:
+                # Conexão de volta: retoma só quem foi interrompido; quem já sincronizou
+                # espera o intervalo normal (consultar de novo arriscaria o 656)
+                certificados = [c for c in certificados if c[3] in cortados_offline]
+                cortados_offline = set()
+                logger.info(f"Retomando {len(certificados)} certificado(s) interrompido(s) sem conexão "
+                            f"em {datetime.now().isoformat()}")
+            else:
+                logger.info(f"Iniciando busca periódica de NSU em {datetime.now().isoformat()}")
             total_certs = len(certificados)
             
+            # Pedidos feitos sem conexão (manifestação, busca por chave, status)
+            drenar_fila_offline(db)
+            
             for idx, (cnpj, path, senha, inf, cuf) in enumerate(certificados, 1):
                 consumo_indevido = False  # Inicializa ANTES do try
                 
@@ -194,6 +211,14 @@ def ciclo_nsu(db, parser, intervalo=3600):
                         logger.info(f"Pulando {inf} - aguardando cooldown erro 656")
                         continue
                     
+                    # Outro certificado já viu a Distribuição DFe fora do ar: não espera timeout
+                    if not saude_endpoints().disponivel(URL_DISTRIBUICAO):
+                        logger.warning(
+                            f"⛔ Pulando {inf} - Distribuição DFe indisponível "
+                            f"(nova tentativa em {saude_endpoints().espera_restante(URL_DISTRIBUICAO):.0f}s)"
+                        )
+                        continue
+                    
                     # ✅ NSU = 0 AUTOMÁTICO: Detecta primeira consulta
                     if ult_nsu == "000000000000000":
                         logger.info(f"🔍 [{inf}] PRIMEIRA CONSULTA DETECTADA - Iniciando varredura completa (NSU=0)")
@@ -315,7 +340,6 @@ def ciclo_nsu(db, parser, intervalo=3600):
                                     salvar_xml_por_certificado(xml, cnpj, pasta_base=None, nome_certificado=nome_cert)
                                     
                                     # Salva nota detalhada
-                                    db.criar_tabela_detalhada()
                                     nota = extrair_nota_detalhada(xml, parser, db, chave, inf)
                                     nota['informante'] = inf  # Adiciona informante (redundância para garantir)
                                     nota['xml_status'] = xml_status  # Marca corretamente: COMPLETO, RESUMO ou EVENTO
@@ -332,7 +356,7 @@ def ciclo_nsu(db, parser, intervalo=3600):
                                     
                                     # Se for evento, atualiza o status da nota original
                                     if xml_status == 'EVENTO':
-                                        processar_evento_status(xml, chave, db)
+                                        processar_evento_status(xml, chave, db, caminho_xml, inf)
                                 except Exception:
                                     logger.exception("Erro ao processar docZip")
                             
@@ -347,6 +371,7 @@ def ciclo_nsu(db, parser, intervalo=3600):
                                 if estado_offline:
                                     logger.info(f"✅ RECONECTADO: Internet/SEFAZ online novamente")
                                     estado_offline = False
+                                    drenar_fila_offline(db)
                                 
                                 if ult != ult_nsu:
                                     # NSU avançou - registra e continua buscando
@@ -374,6 +399,21 @@ def ciclo_nsu(db, parser, intervalo=3600):
                             
                             logger.warning(f"⚠️ Falha #{falha_num} para {inf}: {e}")
                             
+                            # Sem internet: não adianta esperar o retry de cada certificado —
+                            # o fim do ciclo sonda a conexão e recomeça quando ela voltar
+                            if estado_offline and not sonda_conectividade():
+                                logger.warning(f"📴 Sem conexão - encerrando {inf} neste ciclo")
+                                falhas_consecutivas[inf] = 0
+                                cortados_offline.add(inf)
+                                break
+                            
+                            # Falha do próprio endpoint (disjuntor aberto): segue para o próximo
+                            # certificado, que também será pulado, em vez de pausar 10 min por certificado
+                            if not saude_endpoints().disponivel(URL_DISTRIBUICAO):
+                                logger.warning(f"⛔ Distribuição DFe indisponível - encerrando {inf} neste ciclo")
+                                falhas_consecutivas[inf] = 0
+                                break
+                            
                             # MODO INVESTIGAÇÃO: Após 5 falhas consecutivas
                             if falha_num >= MAX_FALHAS_INVESTIGACAO:
                                 logger.critical(f"🔍 MODO INVESTIGAÇÃO ATIVADO para {inf} (5+ falhas consecutivas)")
@@ -396,7 +436,6 @@ def ciclo_nsu(db, parser, intervalo=3600):
                     continue  # vai para o próximo certificado
 
             # Após o ciclo, garante atualização das notas detalhadas a partir dos XMLs já salvos
-            db.criar_tabela_detalhada()
             for xml_file in XML_DIR.rglob("*.xml"):
                 try:
                     xml_txt = xml_file.read_text(encoding="utf-8")
@@ -417,6 +456,23 @@ def ciclo_nsu(db, parser, intervalo=3600):
                 except Exception as e:
                     logger.warning(f"Falha ao extrair/atualizar nota detalhada de {xml_file}: {e}")
 
+            if cortados_offline:
+                # Certificados interrompidos pela queda: sonda a SEFAZ em vez de dormir o
+                # intervalo inteiro; assim que ela responder, retoma só esses certificados
+                # (o ciclo primeiro esvazia a fila offline)
+                logger.info(f"📴 {len(cortados_offline)} certificado(s) interrompido(s) sem conexão. "
+                            f"Aguardando a SEFAZ voltar...")
+                espera = 0
+                while espera < intervalo and not sonda_conectividade():
+                    time.sleep(RETRY_DELAYS[2])
+                    espera += RETRY_DELAYS[2]
+                if espera < intervalo:
+                    logger.info(f"✅ RECONECTADO: Internet/SEFAZ online novamente")
+                    estado_offline = False
+                else:
+                    cortados_offline = set()  # passou o intervalo: o próximo ciclo é completo
+                continue
+
             logger.info(f"Busca de NSU finalizada. Dormindo por {intervalo/60:.0f} minutos...")
 
             time.sleep(intervalo)
@@ -594,51 +650,34 @@ def extrair_cte_detalhado(xml_txt, parser, db, chave, informante=None, nsu_docum
             "nsu": nsu_final  # 🔒 NSU preservado mesmo em erro
         }
 
-def processar_evento_status(xml_txt, chave_evento, db):
+def processar_evento_status(xml_txt, chave_evento, db, caminho_xml=None, informante=None):
     """
-    Processa eventos (cancelamento, carta correção) e atualiza o status da nota original.
+    Processa eventos (cancelamento, carta correção): registra no índice de
+    eventos (modules/eventos_index) e deriva dele o status da nota original.
     """
     try:
-        from lxml import etree
-        
-        root = etree.fromstring(xml_txt.encode('utf-8') if isinstance(xml_txt, str) else xml_txt)
-        ns = '{http://www.portalfiscal.inf.br/nfe}'
-        
-        # Extrai chave da nota referenciada
-        chNFe = root.findtext(f'.//{ns}chNFe')
-        if not chNFe or len(chNFe) != 44:
+        from modules import doc_links
+        from modules.eventos_index import derivar_status, extrair_eventos, registrar
+
+        eventos = extrair_eventos(xml_txt)
+        if not eventos:
             return
-        
-        # Extrai tipo de evento
-        tpEvento = root.findtext(f'.//{ns}tpEvento')
-        
-        # Extrai status do evento
-        cStat = root.findtext(f'.//{ns}cStat')
-        xMotivo = root.findtext(f'.//{ns}xMotivo')
-        
-        # Mapeia eventos para status
-        if tpEvento == '110111' and cStat == '135':  # Cancelamento autorizado
-            novo_status = "Cancelamento de NF-e homologado"
-            db.atualizar_status_por_evento(chNFe, novo_status)
-            logger.info(f"Status atualizado: {chNFe} → {novo_status}")
-        
-        elif tpEvento == '110110' and cStat == '135':  # Carta de correção
-            novo_status = "Carta de Correção registrada"
-            db.atualizar_status_por_evento(chNFe, novo_status)
-            logger.info(f"Status atualizado: {chNFe} → {novo_status}")
-        
+        chaves = sorted({ev.chave for ev in eventos})
+        with db._connect() as conn:
+            registrar(conn, eventos, str(caminho_xml) if caminho_xml else None, informante)
+            doc_links.registrar(conn, doc_links.extrair_vinculos(xml_txt))   # CT-e/MDF-e para a NF-e
+            if derivar_status(conn, chaves):
+                logger.info(f"Status atualizado a partir de evento: {', '.join(chaves)}")
+
+            # Atualiza data_emissao a partir da chave se estiver vazia (AAMM nas posições 2-5)
+            # Garante que notas canceladas/com evento sempre tenham uma data visível na interface
+            for chave in chaves:
+                conn.execute(
+                    "UPDATE notas_detalhadas SET data_emissao = ? "
+                    "WHERE chave = ? AND (data_emissao IS NULL OR data_emissao = '')",
+                    (f"20{chave[2:4]}-{chave[4:6]}-01", chave))
         # Eventos de manifestação (210200-210240) não alteram status principal
 
-        # Atualiza data_emissao a partir da chave se estiver vazia (AAMM nas posições 2-5)
-        # Garante que notas canceladas/com evento sempre tenham uma data visível na interface
-        try:
-            if len(chNFe) >= 6:
-                aa, mm = chNFe[2:4], chNFe[4:6]
-                data_aamm = f"20{aa}-{mm}-01"
-                db.atualizar_data_emissao_se_vazia(chNFe, data_aamm)
-        except Exception as e:
-            logger.debug(f"Erro ao atualizar data_emissao: {e}")
-        
     except Exception as e:
         logger.debug(f"Erro ao processar evento de status: {e}")
 
@@ -679,6 +718,45 @@ def extrair_nota_detalhada(xml_txt, parser, db, chave, informante=None, nsu_docu
         # Tipo desconhecido, tenta NF-e como padrão
         return extrair_nfe_detalhado(xml_txt, parser, db, chave, informante, nsu_documento)
 
+def _extrair_ibs_cbs_nfe(tree, tot=None):
+    """
+    IBS/CBS totais de uma NF-e: <IBSCBSTot><gIBS><vIBS>/<gCBS><vCBS>; na
+    falta, ICMSTot e, por último, o primeiro vIBS/vCBS de qualquer namespace.
+    Usado por todos os caminhos de ingestão, para que o relatório (que lê só
+    o banco) tenha o mesmo valor independente de onde a nota entrou.
+    """
+    v_ibs = ''
+    v_cbs = ''
+    try:
+        ns_nfe = '{http://www.portalfiscal.inf.br/nfe}'
+        ibs_cbs_tot = tree.find(f'.//{ns_nfe}IBSCBSTot')
+        if ibs_cbs_tot is not None:
+            g_ibs = ibs_cbs_tot.find(f'{ns_nfe}gIBS')
+            if g_ibs is not None:
+                v_ibs = g_ibs.findtext(f'{ns_nfe}vIBS') or ''
+            g_cbs = ibs_cbs_tot.find(f'{ns_nfe}gCBS')
+            if g_cbs is not None:
+                v_cbs = g_cbs.findtext(f'{ns_nfe}vCBS') or ''
+        # Fallback: busca em ICMSTot
+        if not v_ibs and tot is not None:
+            v_ibs = tot.findtext(f'{ns_nfe}vIBS') or ''
+        if not v_cbs and tot is not None:
+            v_cbs = tot.findtext(f'{ns_nfe}vCBS') or ''
+        # Fallback sem namespace
+        if not v_ibs or not v_cbs:
+            for el in tree.iter():
+                tag = el.tag if isinstance(el.tag, str) else ''
+                if not v_ibs and (tag == 'vIBS' or tag.endswith('}vIBS')):
+                    v_ibs = el.text or ''
+                elif not v_cbs and (tag == 'vCBS' or tag.endswith('}vCBS')):
+                    v_cbs = el.text or ''
+                if v_ibs and v_cbs:
+                    break
+    except Exception:
+        pass  # IBS/CBS ausente em NF-e anteriores à Reforma Tributária — normal
+    return v_ibs, v_cbs
+
+
 def extrair_nfe_detalhado(xml_txt, parser, db, chave, informante=None, nsu_documento=None):
     """
     Extrai informações detalhadas de uma NF-e.
@@ -740,37 +818,7 @@ def extrair_nfe_detalhado(xml_txt, parser, db, chave, informante=None, nsu_docum
             valor_icms = vICMS if vICMS else ""
 
         # 💰 IBS/CBS (Reforma Tributária 2026)
-        # Estrutura NF-e: <IBSCBSTot><gIBS><vIBS> e <gCBS><vCBS>
-        v_ibs = ''
-        v_cbs = ''
-        try:
-            ns_nfe = '{http://www.portalfiscal.inf.br/nfe}'
-            ibs_cbs_tot = tree.find(f'.//{ns_nfe}IBSCBSTot')
-            if ibs_cbs_tot is not None:
-                g_ibs = ibs_cbs_tot.find(f'{ns_nfe}gIBS')
-                if g_ibs is not None:
-                    v_ibs = g_ibs.findtext(f'{ns_nfe}vIBS') or ''
-                g_cbs = ibs_cbs_tot.find(f'{ns_nfe}gCBS')
-                if g_cbs is not None:
-                    v_cbs = g_cbs.findtext(f'{ns_nfe}vCBS') or ''
-            # Fallback: busca em ICMSTot
-            if not v_ibs and tot is not None:
-                v_ibs = tot.findtext(f'{ns_nfe}vIBS') or ''
-            if not v_cbs and tot is not None:
-                v_cbs = tot.findtext(f'{ns_nfe}vCBS') or ''
-            # Fallback sem namespace
-            if not v_ibs:
-                el = tree.find(".//*[@*[local-name()='vIBS']]") or next(
-                    (e for e in tree.iter() if e.tag.endswith('}vIBS') or e.tag == 'vIBS'), None)
-                if el is not None:
-                    v_ibs = el.text or ''
-            if not v_cbs:
-                el = next(
-                    (e for e in tree.iter() if e.tag.endswith('}vCBS') or e.tag == 'vCBS'), None)
-                if el is not None:
-                    v_cbs = el.text or ''
-        except Exception:
-            pass  # IBS/CBS ausente em NF-e anteriores à Reforma Tributária — normal
+        v_ibs, v_cbs = _extrair_ibs_cbs_nfe(tree, tot)
 
         # Busca status no banco (pode ser None)
         status_db = db.get_nf_status(chave)
@@ -896,18 +944,9 @@ def _registrar_caminho_salvo(chave, cnpj_cpf, caminho, tipo='LOCAL', perfil_nome
     try:
         import sqlite3
         db_path = get_data_dir() / 'notas.db'
+        from modules.schema_migrations import aplicar_migracoes
+        aplicar_migracoes(db_path)  # garante xmls_caminhos (sem DDL após a 1ª chamada)
         with sqlite3.connect(str(db_path)) as conn:
-            # Garante a tabela (idempotente)
-            conn.execute('''CREATE TABLE IF NOT EXISTS xmls_caminhos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chave TEXT NOT NULL,
-                cnpj_cpf TEXT,
-                caminho TEXT NOT NULL,
-                tipo TEXT DEFAULT 'LOCAL',
-                perfil_nome TEXT,
-                salvo_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
-                UNIQUE(chave, caminho)
-            )''')
             conn.execute(
                 '''INSERT INTO xmls_caminhos (chave, cnpj_cpf, caminho, tipo, perfil_nome)
                    VALUES (?, ?, ?, ?, ?)
@@ -947,6 +986,8 @@ def _indexar_xml_no_banco(xml_path: str, cnpj_cpf: str, tipo_doc: str, caminho_p
     try:
         from modules.xml_indexer import parse_nfe, parse_cte, parse_nfse
         from modules.database import DatabaseManager
+        from modules.doc_links import registrar_dados
+        from modules import nfe_itens
 
         db_path = get_data_dir() / 'notas.db'
         db = DatabaseManager(db_path)
@@ -957,12 +998,18 @@ def _indexar_xml_no_banco(xml_path: str, cnpj_cpf: str, tipo_doc: str, caminho_p
                 if caminho_pdf:
                     dados["caminho_pdf"] = caminho_pdf
                 db.upsert_nfe_doc(dados)
+                with db._connect() as conn:
+                    registrar_dados(conn, dados)   # NFref → doc_links
+                    if nfe_itens.ativo(conn):
+                        nfe_itens.indexar_arquivo(conn, xml_path, dados["chave"])
         elif tipo_doc == "CTe":
             dados = parse_cte(xml_path, informante=cnpj_cpf)
             if dados.get("chave"):
                 if caminho_pdf:
                     dados["caminho_pdf"] = caminho_pdf
                 db.upsert_cte_doc(dados)
+                with db._connect() as conn:
+                    registrar_dados(conn, dados)   # NF-e transportadas → doc_links
         elif tipo_doc in ("NFSe", "NFS-e", "NFSE"):
             from modules.xml_indexer import parse_nfse, parse_nfse_abrasf
             try:
@@ -988,6 +1035,9 @@ def _indexar_xml_no_banco(xml_path: str, cnpj_cpf: str, tipo_doc: str, caminho_p
                 if caminho_pdf:
                     dados["caminho_pdf"] = caminho_pdf
                 db.upsert_nfce_doc(dados)
+                with db._connect() as conn:
+                    if nfe_itens.ativo(conn):
+                        nfe_itens.indexar_arquivo(conn, xml_path, dados["chave"])
         elif tipo_doc == "ResNFe":
             # Resumos de NF-e também são indexados (xml_status='RESUMO')
             dados = parse_nfe(xml_path, informante=cnpj_cpf)
@@ -1723,6 +1773,11 @@ URL_CONSULTA_FALLBACK = (
 _WSDL_CLIENT_CACHE = {}
 _WSDL_CACHE_LOCK = None
 
+
+def _descartar_wsdl_client(url):
+    """Documento revalidado mudou: o próximo uso monta o Client a partir do cache atualizado."""
+    _WSDL_CLIENT_CACHE.pop(url, None)
+
 def _get_cached_wsdl_client(wsdl_url, transport, timeout=60):
     """
     Obtém client WSDL do cache ou cria novo com timeout configurável.
@@ -1740,7 +1795,9 @@ def _get_cached_wsdl_client(wsdl_url, transport, timeout=60):
     # Inicializa lock thread-safe
     if _WSDL_CACHE_LOCK is None:
         import threading
+        from modules.wsdl_cache import ao_mudar
         _WSDL_CACHE_LOCK = threading.Lock()
+        ao_mudar(_descartar_wsdl_client)
     
     # Verifica cache primeiro — chave = URL apenas (o transport muda a cada instância
     # mas o WSDL é o mesmo; o client reutiliza o transport passado na criação)
@@ -1756,12 +1813,28 @@ def _get_cached_wsdl_client(wsdl_url, transport, timeout=60):
             logger.debug(f"💾 WSDL cache hit: {wsdl_url[:60]}...")
             return cached_client
     
-    # Cria novo client com timeout e retry
-    logger.info(f"🌐 Baixando WSDL (timeout={timeout}s): {wsdl_url[:80]}...")
+    # WSDL/XSDs persistidos em disco (modules/wsdl_cache): com o cache quente o
+    # Client é montado sem rede; a revalidação roda em segundo plano
+    from modules.wsdl_cache import cache_documentos, revalidar_em_segundo_plano
+    docs_cache = cache_documentos()
+    transport.cache = docs_cache
+    em_disco = docs_cache.get(wsdl_url) is not None
     
     import time
     from zeep.settings import Settings
     
+    # Endpoint fora do ar segundo outro certificado: falha rápido em vez de esperar timeouts.
+    # Daqui em diante todo desfecho é registrado: permite() pode ter reservado a sonda
+    if not em_disco and not saude_endpoints().permite(wsdl_url):
+        logger.warning(f"⛔ WSDL não baixado - endpoint indisponível: {wsdl_url[:80]}")
+        return None
+    
+    # Cria novo client com timeout e retry
+    if em_disco:
+        logger.debug(f"💾 WSDL do cache em disco: {wsdl_url[:80]}")
+    else:
+        logger.info(f"🌐 Baixando WSDL (timeout={timeout}s): {wsdl_url[:80]}...")
+    
     max_retries = 2
     retry_delay = 5  # segundos
     
@@ -1784,6 +1857,10 @@ def _get_cached_wsdl_client(wsdl_url, transport, timeout=60):
             elapsed = time.time() - start_time
             
             logger.info(f"✅ WSDL carregado em {elapsed:.2f}s (tentativa {attempt}/{max_retries})")
+            if em_disco:
+                revalidar_em_segundo_plano(transport.session)
+            else:
+                saude_endpoints().registrar_sucesso(wsdl_url, elapsed)
             
             # Salva no cache
             with _WSDL_CACHE_LOCK:
@@ -1807,6 +1884,9 @@ def _get_cached_wsdl_client(wsdl_url, transport, timeout=60):
                 retry_delay *= 2  # Backoff exponencial
             else:
                 logger.error(f"❌ Falha definitiva ao baixar WSDL após {attempt} tentativas: {error_msg[:200]}")
+                # Sem cache em disco, qualquer falha (503, 403, XML inválido...) encerra a sonda
+                if not em_disco or is_timeout or is_connection:
+                    saude_endpoints().registrar_falha(wsdl_url, error_msg)
                 return None
     
     return None
@@ -1818,12 +1898,6 @@ class DatabaseManager:
         self.db_path = db_path
         logger.info(f"🔧 Inicializando banco de dados: {db_path}")
         self._initialize()
-        logger.info("🔧 _initialize() concluído")
-        # 🔒 CRÍTICO: Garante que notas_detalhadas existe com TODAS as colunas
-        self.criar_tabela_detalhada()
-        logger.info("🔧 criar_tabela_detalhada() concluído")
-        # Verifica se a tabela foi criada corretamente
-        self._verify_nsu_column()
         logger.info(f"✅ Banco inicializado com sucesso em {db_path}")
 
     def get_nf_status(self, chave):
@@ -1849,18 +1923,7 @@ class DatabaseManager:
             valor = tot.findtext('{http://www.portalfiscal.inf.br/nfe}vNF') if tot is not None else ''
             
             # Extrai IBS e CBS (Reforma Tributária)
-            ibs_cbs_tot = inf.find('.//{http://www.portalfiscal.inf.br/nfe}IBSCBSTot')
-            v_ibs = ''
-            v_cbs = ''
-            if ibs_cbs_tot is not None:
-                # IBS: gIBS/vIBS
-                g_ibs = ibs_cbs_tot.find('{http://www.portalfiscal.inf.br/nfe}gIBS')
-                if g_ibs is not None:
-                    v_ibs = g_ibs.findtext('{http://www.portalfiscal.inf.br/nfe}vIBS') or ''
-                # CBS: gCBS/vCBS
-                g_cbs = ibs_cbs_tot.find('{http://www.portalfiscal.inf.br/nfe}gCBS')
-                if g_cbs is not None:
-                    v_cbs = g_cbs.findtext('{http://www.portalfiscal.inf.br/nfe}vCBS') or ''
+            v_ibs, v_cbs = _extrair_ibs_cbs_nfe(inf, tot)
 
             chave = inf.attrib.get('Id','')[-44:]
             ie_tomador = dest.findtext('{http://www.portalfiscal.inf.br/nfe}IE') if dest is not None else ''
@@ -1900,243 +1963,26 @@ class DatabaseManager:
         return sqlite3.connect(self.db_path)
 
     def _initialize(self):
-        with self._connect() as conn:
-            cur = conn.cursor()
-            cur.execute('''CREATE TABLE IF NOT EXISTS certificados (
-                id INTEGER PRIMARY KEY,
-                cnpj_cpf TEXT,
-                caminho TEXT,
-                senha TEXT,
-                informante TEXT,
-                cUF_autor TEXT
-            )''')
-            cur.execute('''CREATE TABLE IF NOT EXISTS xmls_baixados (
-                chave TEXT PRIMARY KEY,
-                cnpj_cpf TEXT,
-                caminho_arquivo TEXT,
-                xml_completo TEXT,
-                baixado_em TEXT
-            )''')
-            # Migração: adicionar coluna xml_completo se não existir
-            try:
-                cur.execute("ALTER TABLE xmls_baixados ADD COLUMN xml_completo TEXT")
-            except:
-                pass  # Coluna já existe
-            # 📂 TABELA DE CAMINHOS SALVOS - rastreamento completo de todos os destinos
-            # Cada XML pode estar salvo em múltiplos lugares (backup local, NFs, Domínio, etc.)
-            cur.execute('''CREATE TABLE IF NOT EXISTS xmls_caminhos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chave TEXT NOT NULL,
-                cnpj_cpf TEXT,
-                caminho TEXT NOT NULL,
-                tipo TEXT DEFAULT 'LOCAL',
-                perfil_nome TEXT,
-                salvo_em TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
-                UNIQUE(chave, caminho)
-            )''')
-            try:
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_xmls_caminhos_chave ON xmls_caminhos(chave)")
-            except:
-                pass
-            cur.execute('''CREATE TABLE IF NOT EXISTS nf_status (
-                chNFe TEXT PRIMARY KEY,
-                cStat TEXT,
-                xMotivo TEXT
-            )''')
-            cur.execute('''CREATE TABLE IF NOT EXISTS nsu (
-                informante TEXT PRIMARY KEY,
-                ult_nsu TEXT
-            )''')
-            cur.execute('''CREATE TABLE IF NOT EXISTS nsu_cte (
-                informante TEXT PRIMARY KEY,
-                ult_nsu TEXT
-            )''')
-            cur.execute('''CREATE TABLE IF NOT EXISTS erro_656 (
-                informante TEXT PRIMARY KEY,
-                ultimo_erro TIMESTAMP,
-                nsu_bloqueado TEXT
-            )''')
-            cur.execute('''CREATE TABLE IF NOT EXISTS notas_verificadas (
-                chave TEXT PRIMARY KEY,
-                verificada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                resultado TEXT
-            )''')
-            cur.execute('''CREATE TABLE IF NOT EXISTS manifestacoes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chave TEXT NOT NULL,
-                tipo_evento TEXT NOT NULL,
-                informante TEXT NOT NULL,
-                data_manifestacao TEXT NOT NULL,
-                status TEXT,
-                protocolo TEXT,
-                UNIQUE(chave, tipo_evento, informante)
-            )''')
-            # 📊 TABELA DE HISTÓRICO DE NSU - Auditoria completa de consultas
-            cur.execute('''CREATE TABLE IF NOT EXISTS historico_nsu (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                certificado TEXT NOT NULL,
-                informante TEXT NOT NULL,
-                nsu_consultado TEXT NOT NULL,
-                data_hora_consulta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                total_xmls_retornados INTEGER DEFAULT 0,
-                total_nfe INTEGER DEFAULT 0,
-                total_cte INTEGER DEFAULT 0,
-                total_nfse INTEGER DEFAULT 0,
-                total_eventos INTEGER DEFAULT 0,
-                detalhes_json TEXT,
-                status TEXT DEFAULT 'sucesso',
-                mensagem_erro TEXT,
-                tempo_processamento_ms INTEGER
-            )''')
-            # Índices para histórico NSU (performance em consultas de auditoria)
-            try:
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_historico_certificado ON historico_nsu(certificado, informante, nsu_consultado)")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_historico_data ON historico_nsu(data_hora_consulta)")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_historico_informante ON historico_nsu(informante)")
-            except:
-                pass  # Índices já existem
-            conn.commit()
-            logger.debug("Tabelas verificadas/criadas no banco (incluindo histórico NSU)")
+        """
+        Aplica as migrações pendentes do esquema (modules/schema_migrations).
+
+        Com o banco já na versão corrente não executa DDL nenhuma; dentro do
+        mesmo processo as próximas construções nem abrem conexão.
+        """
+        from modules.schema_migrations import aplicar_migracoes
+        aplicar_migracoes(self.db_path)
+        logger.debug("Esquema do banco verificado (schema_version)")
     
     def criar_tabela_detalhada(self):
         """
-        Cria a tabela notas_detalhadas com todos os campos necessários.
-        
-        🔒 CRÍTICO: Inclui coluna NSU para rastreamento de documentos baixados.
+        Garante a tabela notas_detalhadas (com coluna NSU).
+
+        Mantido por compatibilidade: a estrutura é criada pelas migrações, então
+        esta chamada é gratuita depois da primeira no processo.
         """
-        logger.info("🔧 Criando/verificando tabela notas_detalhadas...")
-        try:
-            with self._connect() as conn:
-                # Cria a tabela com todos os campos necessários
-                conn.execute('''
-                CREATE TABLE IF NOT EXISTS notas_detalhadas (
-                    chave TEXT PRIMARY KEY,
-                    ie_tomador TEXT,
-                    nome_emitente TEXT,
-                    cnpj_emitente TEXT,
-                    numero TEXT,
-                    data_emissao TEXT,
-                    tipo TEXT,
-                    valor TEXT,
-                    cfop TEXT,
-                    vencimento TEXT,
-                    ncm TEXT,
-                    status TEXT DEFAULT 'Autorizado o uso da NF-e',
-                    natureza TEXT,
-                    uf TEXT,
-                    base_icms TEXT,
-                    valor_icms TEXT,
-                    informante TEXT,
-                    xml_status TEXT DEFAULT 'COMPLETO',
-                    atualizado_em DATETIME,
-                    cnpj_destinatario TEXT,
-                    nsu TEXT
-                )
-                ''')
-                conn.commit()
-                logger.info("✅ Tabela notas_detalhadas criada/verificada")
-                
-                # 🔒 MIGRAÇÃO FORÇADA: Verifica colunas existentes ANTES de tentar adicionar
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA table_info(notas_detalhadas)")
-                existing_columns = {row[1] for row in cursor.fetchall()}
-                logger.info(f"🔍 Colunas existentes em notas_detalhadas: {existing_columns}")
-                
-                # 🔒 MIGRAÇÃO CRÍTICA: Garante que as colunas existem (caso o banco seja antigo)
-                columns_to_add = [
-                    ("cnpj_destinatario", "TEXT"),
-                    ("nome_destinatario", "TEXT"),  # Nome do tomador/destinatário
-                    ("xml_status", "TEXT DEFAULT 'COMPLETO'"),
-                    ("ncm", "TEXT"),
-                    ("base_icms", "TEXT"),
-                    ("valor_icms", "TEXT"),
-                    ("informante", "TEXT"),
-                    ("nsu", "TEXT"),  # 🔒 NSU CRÍTICO para rastreamento
-                    ("v_ibs", "TEXT"),  # 💰 IBS - Reforma Tributária
-                    ("v_cbs", "TEXT")   # 💰 CBS - Reforma Tributária
-                ]
-                
-                for col_name, col_type in columns_to_add:
-                    if col_name not in existing_columns:
-                        try:
-                            # Remove DEFAULT da string para ALTER TABLE (SQLite não suporta DEFAULT no ALTER TABLE)
-                            col_type_clean = col_type.replace(" DEFAULT 'COMPLETO'", "")
-                            conn.execute(f"ALTER TABLE notas_detalhadas ADD COLUMN {col_name} {col_type_clean}")
-                            logger.info(f"✅ Coluna '{col_name}' adicionada à tabela notas_detalhadas")
-                            conn.commit()
-                        except sqlite3.OperationalError as e:
-                            logger.error(f"❌ Erro ao adicionar coluna '{col_name}': {e}")
-                    else:
-                        logger.debug(f"✓ Coluna '{col_name}' já existe")
-                
-                # Verifica novamente após adicionar
-                cursor.execute("PRAGMA table_info(notas_detalhadas)")
-                final_columns = {row[1] for row in cursor.fetchall()}
-                logger.info(f"🔍 Colunas finais em notas_detalhadas: {final_columns}")
-                
-                # Valida colunas críticas
-                if 'nsu' not in final_columns:
-                    logger.error("🚨 CRÍTICO: Coluna 'nsu' AINDA NÃO EXISTE após migração!")
-                    raise Exception("FALHA CRÍTICA: Não foi possível adicionar coluna 'nsu'")
-                else:
-                    logger.info("✅ Coluna 'nsu' confirmada!")
-                
-                # 🔒 ÍNDICES CRÍTICOS para performance de consultas NSU
-                # Índice composto para buscar último NSU por informante
-                try:
-                    conn.execute("CREATE INDEX IF NOT EXISTS idx_nsu_informante ON notas_detalhadas(informante, nsu)")
-                    logger.debug("✅ Índice idx_nsu_informante criado")
-                except Exception as e:
-                    logger.debug(f"Índice idx_nsu_informante já existe: {e}")
-                
-                # Índice para buscar por NSU específico
-                try:
-                    conn.execute("CREATE INDEX IF NOT EXISTS idx_nsu ON notas_detalhadas(nsu)")
-                    logger.debug("✅ Índice idx_nsu criado")
-                except Exception as e:
-                    logger.debug(f"Índice idx_nsu já existe: {e}")
-                
-                # Índice para buscar por data de emissão (útil para auditoria)
-                try:
-                    conn.execute("CREATE INDEX IF NOT EXISTS idx_data_emissao ON notas_detalhadas(data_emissao)")
-                    logger.debug("✅ Índice idx_data_emissao criado")
-                except Exception as e:
-                    logger.debug(f"Índice idx_data_emissao já existe: {e}")
-                
-                conn.commit()
-                logger.info("✅ Tabela notas_detalhadas verificada/criada com sucesso")
-        except Exception as e:
-            logger.error(f"❌ ERRO CRÍTICO ao criar tabela notas_detalhadas: {e}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            raise
-    
-    def _verify_nsu_column(self):
-        """Verifica se a coluna NSU existe na tabela notas_detalhadas."""
-        try:
-            with self._connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA table_info(notas_detalhadas)")
-                columns = [row[1] for row in cursor.fetchall()]
-                logger.info(f"🔍 Colunas encontradas em notas_detalhadas: {columns}")
-                if 'nsu' not in columns:
-                    logger.error("❌ CRÍTICO: Coluna 'nsu' não encontrada! Recriando tabela...")
-                    # Força recriação
-                    self.criar_tabela_detalhada()
-                    # Verifica novamente
-                    cursor.execute("PRAGMA table_info(notas_detalhadas)")
-                    columns_after = [row[1] for row in cursor.fetchall()]
-                    logger.info(f"🔍 Colunas após recriar: {columns_after}")
-                    if 'nsu' not in columns_after:
-                        logger.error("❌ FALHA CRÍTICA: Coluna 'nsu' AINDA não existe após recriar!")
-                    else:
-                        logger.info("✅ Coluna 'nsu' criada com sucesso")
-                else:
-                    logger.info("✅ Coluna 'nsu' verificada com sucesso")
-        except Exception as e:
-            logger.error(f"❌ Erro ao verificar coluna nsu: {e}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
+        from modules.schema_migrations import aplicar_migracoes
+        aplicar_migracoes(self.db_path)
+
 
     def salvar_nota_detalhada(self, nota):
         """
@@ -2180,8 +2026,8 @@ class DatabaseManager:
                 row = cursor.fetchone()
                 
                 if row and row[0]:  # Tem registro com caminho
-                    from pathlib import Path
-                    if Path(row[0]).exists():
+                    from modules.arquivo_mensal import caminho_existe
+                    if caminho_existe(row[0]):  # arquivo solto ou dentro do ZIP mensal
                         # ✅ XML existe no disco
                         if xml_status != 'COMPLETO':
                             logger.debug(f"🔄 Auto-upgrade: {chave[:25]}... RESUMO → COMPLETO (XML encontrado)")
@@ -2200,8 +2046,8 @@ class DatabaseManager:
                             (chave,)
                         ).fetchone()
                         if row_c and row_c[0]:
-                            from pathlib import Path as _Path
-                            if _Path(row_c[0]).exists():
+                            from modules.arquivo_mensal import caminho_existe
+                            if caminho_existe(row_c[0]):
                                 caminho_alt = row_c[0]
                     except Exception:
                         pass  # tabela pode não existir em instalações antigas
@@ -2353,28 +2199,6 @@ class DatabaseManager:
             str: NSU de 15 dígitos (ex: '000000000001234')
         """
         with self._connect() as conn:
-            # 🔒 PRIMEIRA COISA: Verifica se coluna nsu existe ANTES de qualquer query
-            try:
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA table_info(notas_detalhadas)")
-                columns = [row[1] for row in cursor.fetchall()]
-                logger.debug(f"🔍 [get_last_nsu] Colunas encontradas: {columns}")
-                
-                if 'nsu' not in columns:
-                    logger.error(f"❌ CRÍTICO: Coluna 'nsu' NÃO EXISTE em get_last_nsu! Forçando criação imediata...")
-                    # Fecha conexão atual para evitar locks
-                    conn.close()
-                    # Força criação da coluna
-                    self.criar_tabela_detalhada()
-                    logger.info(f"✅ criar_tabela_detalhada() executado de get_last_nsu")
-                    # IMPORTANTE: Retorna valor padrão e deixa próxima chamada usar coluna criada
-                    logger.warning(f"⚠️ Retornando NSU zero devido à recriação de estrutura")
-                    return "000000000000000"
-            except Exception as e:
-                logger.error(f"❌ Erro na verificação de coluna nsu: {e}")
-                logger.warning(f"⚠️ Retornando NSU zero devido a erro de verificação")
-                return "000000000000000"
-            
             # 1️⃣ Busca NSU oficial na tabela de controle
             row = conn.execute(
                 "SELECT ult_nsu FROM nsu WHERE informante=?", (informante,)
@@ -2754,7 +2578,9 @@ class DatabaseManager:
             total_xmls = len(xmls_retornados)
             
             # Converte detalhes para JSON (limitado para não sobrecarregar)
-            detalhes_json = json.dumps(xmls_retornados[:100], ensure_ascii=False)  # Máx 100 itens
+            # e grava compactado (BLOB zlib) — lido de volta via descompactar()
+            from modules.payload_codec import compactar
+            detalhes_json = compactar(json.dumps(xmls_retornados[:100], ensure_ascii=False))  # Máx 100 itens
             
             with self._connect() as conn:
                 cursor = conn.execute('''
@@ -2836,9 +2662,12 @@ class DatabaseManager:
                       'total_cte', 'total_nfse', 'total_eventos', 'detalhes_json',
                       'status', 'mensagem_erro', 'tempo_processamento_ms']
             
+            from modules.payload_codec import descompactar
             historico = []
             for row in rows:
-                historico.append(dict(zip(colunas, row)))
+                registro = dict(zip(colunas, row))
+                registro['detalhes_json'] = descompactar(registro['detalhes_json'])
+                historico.append(registro)
             
             logger.debug(f"📊 Histórico NSU: {len(historico)} registros encontrados")
             return historico
@@ -3386,6 +3215,14 @@ class DatabaseManager:
             logger.debug(f"Manifestação já existe ou erro: {e}")
             return False
 
+    def enfileirar_requisicao(self, tipo: str, informante: str, chave: str,
+                              payload: dict = None, apos: float = 0) -> bool:
+        """Guarda um pedido à SEFAZ para ser refeito quando houver conexão (modules/fila_offline)."""
+        with self._connect() as conn:
+            novo = enfileirar(conn, tipo, informante, chave, payload, apos=apos)
+            conn.commit()
+            return novo
+
 # -------------------------------------------------------------------
 # Processador de XML
 # -------------------------------------------------------------------
@@ -3680,6 +3517,146 @@ def cte_consultar_por_chave(chave: str, cert_path, senha, informante: str = '',
     return None
 
 
+# URLs do NFeConsultaProtocolo4 (endpoint SOAP, sem ?wsdl) por cUF
+_NFE_PROT_URL_SVRS = 'https://www.sefazvirtual.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx'
+_NFE_PROT_URL_MAP = {
+    '31': 'https://nfe.fazenda.mg.gov.br/nfe2/services/NFeConsultaProtocolo4',  # MG
+    '50': 'https://nfe.sefaz.ms.gov.br/ws/NFeConsultaProtocolo4',  # MS
+    '51': _NFE_PROT_URL_SVRS,  # SVRS
+    '52': _NFE_PROT_URL_SVRS,  # GO
+    '35': 'https://nfe.fazenda.sp.gov.br/ws/nfeconsultaprotocolo4.asmx',  # SP
+    '33': 'https://nfe.fazenda.rj.gov.br/ws/NFeConsultaProtocolo4',  # RJ
+    '41': 'https://nfe.sefa.pr.gov.br/nfe/NFeConsultaProtocolo4',  # PR
+    '53': 'https://nfe.sefaz.df.gov.br/ws/NFeConsultaProtocolo4',  # DF
+}
+
+
+def _nfe_prot_url_por_cuf(cuf: str) -> str:
+    """Retorna a URL do serviço NFeConsultaProtocolo4 para o cUF fornecido."""
+    return _NFE_PROT_URL_MAP.get(str(cuf), _NFE_PROT_URL_SVRS)
+
+
+# Contingência (SVC) da consulta de protocolo NF-e: SVC-RS atende AM, BA, GO, MA, MS,
+# MT, PE e PR; SVC-AN atende as demais UFs. A SVC só conhece notas que ela mesma
+# autorizou — para as demais responde 217, tratado pelos chamadores como "não encontrada".
+_NFE_PROT_URL_SVC_AN = 'https://www.svc.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx'
+_NFE_PROT_URL_SVC_RS = 'https://nfe.svrs.rs.gov.br/ws/NfeConsulta/NfeConsulta4.asmx'
+_UFS_SVC_RS = {'13', '29', '52', '21', '50', '51', '26', '41'}
+
+
+def _urls_protocolo(cuf: str, modelo: str) -> list:
+    """Endpoint da UF seguido dos de contingência (SVC para NF-e, SVRS para CT-e)."""
+    if modelo == '57':
+        urls = [_cte_url_por_cuf(cuf), _CTE_URL_SVRS]
+    else:
+        svc = _NFE_PROT_URL_SVC_RS if str(cuf) in _UFS_SVC_RS else _NFE_PROT_URL_SVC_AN
+        urls = [_nfe_prot_url_por_cuf(cuf), svc]
+    return list(dict.fromkeys(urls))
+
+
+def _url_protocolo(cuf: str, modelo: str) -> str:
+    return _urls_protocolo(cuf, modelo)[0]
+
+
+def _post_soap(sessao, url: str, soap_envelope: str, headers: dict):
+    """POST do envelope; HTTP >= 400 vira exceção (5xx sem SOAP Fault conta como falha do endpoint)."""
+    resp = sessao.post(url, data=soap_envelope.encode('utf-8'), headers=headers)
+    resp.raise_for_status()
+    return resp
+
+
+def _envelope_protocolo(chave: str, modelo: str, tp_amb: str = '1') -> bytes:
+    """Envelope SOAP 1.2 de consSitNFe (55/65) ou consSitCTe (57), sem prefixos."""
+    if modelo == '57':
+        corpo = (
+            '<cteDadosMsg xmlns="http://www.portalfiscal.inf.br/cte/wsdl/CTeConsultaV4">'
+            f'<consSitCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">'
+            f'<tpAmb>{tp_amb}</tpAmb><xServ>CONSULTAR</xServ><chCTe>{chave}</chCTe></consSitCTe>'
+            '</cteDadosMsg>'
+        )
+    else:
+        corpo = (
+            '<nfeDadosMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeConsultaProtocolo4">'
+            f'<consSitNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+            f'<tpAmb>{tp_amb}</tpAmb><xServ>CONSULTAR</xServ><chNFe>{chave}</chNFe></consSitNFe>'
+            '</nfeDadosMsg>'
+        )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope"'
+        ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+        ' xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+        f'<soap12:Body>{corpo}</soap12:Body>'
+        '</soap12:Envelope>'
+    ).encode('utf-8')
+
+
+def _sessao_protocolo(cert_path, senha):
+    """Sessão PKCS12 com pool de conexões do tamanho do limite por endpoint."""
+    import requests
+    import requests_pkcs12 as _rpkcs12
+    from modules.consulta_protocolo_lote import MAX_POR_ENDPOINT
+
+    sess = requests.Session()
+    sess.mount('https://', _rpkcs12.Pkcs12Adapter(
+        pkcs12_filename=cert_path, pkcs12_password=senha,
+        pool_connections=8, pool_maxsize=MAX_POR_ENDPOINT * 2,
+    ))
+    return sess
+
+
+def consultar_protocolos_lote(chaves, cert_path, senha, informante: str = '',
+                              ambiente: str = 'producao', ttl=None, max_por_endpoint=None):
+    """
+    Consulta a situação de muitas NF-e/NFC-e/CT-e de uma vez
+    (modules/consulta_protocolo_lote): agrupa por cUF/modelo, usa uma sessão
+    quente por certificado, limita a concorrência por endpoint e reaproveita
+    respostas recentes.
+
+    Yields:
+        (chave, xml) à medida que as respostas chegam — xml é o elemento-filho
+        do SOAP Body (mesmo formato de fetch_prot_nfe/fetch_prot_cte) ou None.
+    """
+    from modules.certificate_manager import determinar_verify_para_host
+    from modules.consulta_protocolo_lote import (
+        MAX_POR_ENDPOINT, ConsultaProtocoloLote, pool_compartilhado,
+    )
+
+    tp_amb = '1' if ambiente == 'producao' else '2'
+    sess = pool_compartilhado().obter(f"{cert_path}|{tp_amb}", lambda: _sessao_protocolo(cert_path, senha))
+
+    def _post(url, chave, modelo):
+        resp = sess.post(
+            url,
+            data=_envelope_protocolo(chave, modelo, tp_amb),
+            headers={'Content-Type': 'application/soap+xml; charset=utf-8'},
+            timeout=30,
+            verify=determinar_verify_para_host(url, cert_path, senha),
+        )
+        resp.raise_for_status()
+        return resp
+
+    def _consultar(url, chave, modelo):
+        # Endpoint da UF fora do ar → contingência (modules/saude_endpoints)
+        resp = saude_endpoints().chamar(
+            [url] + _urls_protocolo(chave[:2], modelo), lambda u: _post(u, chave, modelo)
+        )
+        body = etree.fromstring(resp.content).find('.//{http://www.w3.org/2003/05/soap-envelope}Body')
+        if body is None or len(body) == 0:
+            return None
+        return etree.tostring(body[0], encoding='unicode')
+
+    lote = ConsultaProtocoloLote(
+        _consultar, _url_protocolo,
+        max_por_endpoint=max_por_endpoint or MAX_POR_ENDPOINT,
+        ttl=ttl, escopo=f"{informante}|{tp_amb}",
+    )
+    for resultado in lote.executar(chaves):
+        if resultado.erro:
+            logger.warning(f"⚠️ [Protocolo-Lote] [{informante}] {resultado.chave}: {resultado.erro}")
+        yield resultado.chave, resultado.xml
+
+
 # -------------------------------------------------------------------
 # Serviço SOAP
 # -------------------------------------------------------------------
@@ -3803,8 +3780,14 @@ class NFeService:
         logger.info(f"   📋 Payload: distDFeInt (consChNFe={chave}, cUF={self.cuf})")
         logger.info(f"   📏 Tamanho XML: {len(xml_envio)} bytes")
 
+        saude = saude_endpoints()
+        if not saude.permite(URL_DISTRIBUICAO):
+            logger.warning(f"⛔ [{self.informante}] Distribuição DFe indisponível (falhas recentes) - consulta não enviada")
+            return None
+        inicio = time.monotonic()
         try:
             resp = self.dist_client.service.nfeDistDFeInteresse(nfeDadosMsg=distInt)
+            saude.registrar_sucesso(URL_DISTRIBUICAO, time.monotonic() - inicio)
             
             # 🌐 DEBUG HTTP: Informações da resposta
             logger.info(f"✅ [{self.informante}] HTTP RESPONSE Distribuição por Chave recebida")
@@ -3813,12 +3796,14 @@ class NFeService:
                 logger.debug(f"   🔍 Atributos: {list(resp.__dict__.keys())[:5]}...")
             
         except Fault as fault:
+            saude.registrar_sucesso(URL_DISTRIBUICAO, time.monotonic() - inicio)  # servidor respondeu
             logger.error(f"SOAP Fault Distribuição por Chave: {fault}")
             logger.error(f"   ❌ Falha na comunicação SOAP")
             # 🔍 DEBUG: Salva erro SOAP
             save_debug_soap(self.informante, "fault", str(fault), prefixo="nfe_dist_chave")
             return None
         except Exception as e:
+            saude.registrar_falha(URL_DISTRIBUICAO, e)
             logger.error(f"❌ [{self.informante}] Erro HTTP na distribuição por chave: {e}")
             logger.exception(e)
             return None
@@ -3863,8 +3848,14 @@ class NFeService:
         logger.info(f"   📋 Payload: distDFeInt (ultNSU={ult_nsu}, cUF={self.cuf})")
         logger.info(f"   📏 Tamanho XML: {len(xml_envio)} bytes")
 
+        saude = saude_endpoints()
+        if not saude.permite(URL_DISTRIBUICAO):
+            logger.warning(f"⛔ [{self.informante}] Distribuição DFe indisponível (falhas recentes) - consulta não enviada")
+            return None
+        inicio = time.monotonic()
         try:
             resp = self.dist_client.service.nfeDistDFeInteresse(nfeDadosMsg=distInt)
+            saude.registrar_sucesso(URL_DISTRIBUICAO, time.monotonic() - inicio)
             
             # 🌐 DEBUG HTTP: Informações da resposta
             logger.info(f"✅ [{self.informante}] HTTP RESPONSE Distribuição recebida")
@@ -3873,12 +3864,14 @@ class NFeService:
                 logger.debug(f"   🔍 Atributos: {list(resp.__dict__.keys())[:5]}...")
             
         except Fault as fault:
+            saude.registrar_sucesso(URL_DISTRIBUICAO, time.monotonic() - inicio)  # servidor respondeu
             logger.error(f"SOAP Fault Distribuição: {fault}")
             logger.error(f"   ❌ Falha na comunicação SOAP")
             # 🔍 DEBUG: Salva erro SOAP
             save_debug_soap(self.informante, "fault", str(fault), prefixo="nfe_dist")
             return None
         except Exception as e:
+            saude.registrar_falha(URL_DISTRIBUICAO, e)
             logger.error(f"❌ [{self.informante}] Erro HTTP na distribuição: {e}")
             logger.exception(e)
             return None
@@ -3906,17 +3899,7 @@ class NFeService:
         # Chave NFe: posições 0-1 = cUF
         cuf_from_chave = chave[:2] if len(chave) == 44 else str(self.cuf)
         
-        url_map = {
-            '31': 'https://nfe.fazenda.mg.gov.br/nfe2/services/NFeConsultaProtocolo4',  # MG
-            '50': 'https://nfe.sefaz.ms.gov.br/ws/NFeConsultaProtocolo4',  # MS
-            '51': 'https://www.sefazvirtual.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx',  # SVRS
-            '52': 'https://www.sefazvirtual.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx',  # GO
-            '35': 'https://nfe.fazenda.sp.gov.br/ws/nfeconsultaprotocolo4.asmx',  # SP
-            '33': 'https://nfe.fazenda.rj.gov.br/ws/NFeConsultaProtocolo4',  # RJ
-            '41': 'https://nfe.sefa.pr.gov.br/nfe/NFeConsultaProtocolo4',  # PR
-            '53': 'https://nfe.sefaz.df.gov.br/ws/NFeConsultaProtocolo4',  # DF
-        }
-        url = url_map.get(cuf_from_chave, 'https://www.sefazvirtual.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx')
+        url = _nfe_prot_url_por_cuf(cuf_from_chave)
         
         # Monta XML SEM prefixos de namespace (SEFAZ rejeita prefixos)
         xml_consulta = f'''<consSitNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><tpAmb>1</tpAmb><xServ>CONSULTAR</xServ><chNFe>{chave}</chNFe></consSitNFe>'''
@@ -3953,7 +3936,12 @@ class NFeService:
             logger.info(f"   🔐 Certificado: PKCS12 via sessão requests")
             
             # Usa a sessão que já tem o certificado configurado
-            resp = self.dist_client.transport.session.post(url, data=soap_envelope.encode('utf-8'), headers=headers)
+            # UF fora do ar → contingência; disjuntor compartilhado entre certificados
+            sessao = self.dist_client.transport.session
+            resp = saude_endpoints().chamar(
+                [url] + _urls_protocolo(cuf_from_chave, '55'),
+                lambda u: _post_soap(sessao, u, soap_envelope, headers)
+            )
             
             # 🌐 DEBUG HTTP: Informações da resposta
             logger.info(f"✅ [{self.informante}] HTTP RESPONSE Protocolo:")
@@ -4062,7 +4050,12 @@ class NFeService:
             logger.info(f"   🔐 Certificado: PKCS12 via sessão requests")
             
             # Usa a sessão que já tem o certificado configurado
-            resp = self.dist_client.transport.session.post(url, data=soap_envelope.encode('utf-8'), headers=headers)
+            # UF fora do ar → contingência; disjuntor compartilhado entre certificados
+            sessao = self.dist_client.transport.session
+            resp = saude_endpoints().chamar(
+                [url] + _urls_protocolo(cuf_from_chave, '57'),
+                lambda u: _post_soap(sessao, u, soap_envelope, headers)
+            )
             
             # 🌐 DEBUG HTTP: Informações da resposta
             logger.info(f"✅ [{self.informante}] HTTP RESPONSE Protocolo CT-e:")
@@ -4123,8 +4116,10 @@ class NFeService:
             
         Returns:
             XML com os eventos encontrados ou None se não houver
+            (self.falha_de_rede indica se o None veio de SEFAZ/internet fora do ar)
         """
         logger.debug(f"Consultando eventos para chave={chave}")
+        self.falha_de_rede = False
         
         # Define URL do serviço baseado no cUF (extrai da chave)
         cuf_from_chave = chave[:2] if len(chave) == 44 else str(self.cuf)
@@ -4203,7 +4198,12 @@ class NFeService:
             
             logger.info(f"🔍 Consultando eventos da chave {'CTe' if is_cte else 'NFe'}: {chave}")
             
-            resp = self.dist_client.transport.session.post(url, data=soap_envelope.encode('utf-8'), headers=headers)
+            # UF fora do ar → contingência; disjuntor compartilhado entre certificados
+            sessao = self.dist_client.transport.session
+            resp = saude_endpoints().chamar(
+                [url] + _urls_protocolo(cuf_from_chave, ('57' if is_cte else '55')),
+                lambda u: _post_soap(sessao, u, soap_envelope, headers)
+            )
             resp.raise_for_status()
             
             save_debug_soap(self.informante, "response_eventos", resp.content.decode('utf-8'), prefixo=f"eventos_{chave[:10]}")
@@ -4220,9 +4220,11 @@ class NFeService:
                 return None
                 
         except requests.exceptions.RequestException as e:
+            self.falha_de_rede = erro_de_rede(e)
             logger.error(f"Erro na requisição HTTP eventos: {e}")
             return None
         except Exception as e:
+            self.falha_de_rede = erro_de_rede(e)
             logger.error(f"Erro ao consultar eventos: {e}")
             return None
 
@@ -4422,8 +4424,6 @@ def processar_cte(db, cert_data):
                     logger.debug(f"💾 [{inf}] CT-e {chave_cte}: Salvando nos perfis de armazenamento...")
                     salvar_xml_por_certificado(xml_cte, cnpj, pasta_base=None, nome_certificado=nome_cert)
                     
-                    db.criar_tabela_detalhada()
-                    
                     logger.debug(f"📝 [{inf}] CT-e {chave_cte}: Extraindo nota detalhada...")
                     nota_cte = extrair_nota_detalhada(xml_cte, parser, db, chave_cte, inf, nsu)
                     nota_cte['informante'] = inf  # Garantir informante
@@ -4930,7 +4930,6 @@ def salvar_nfse_detalhada(xml_content, nsu, informante):
         }
         
         # Salva no banco (agora com caminho do XML registrado)
-        db.criar_tabela_detalhada()
         db.salvar_nota_detalhada(nota_nfse)
         
         # 🔄 ATUALIZAÇÃO INTERFACE: Notifica interface sobre nova nota
@@ -5045,147 +5044,88 @@ def processar_nfse(cert_data, db):
         # A busca só para com cStat=137 ou sem resposta
         logger.info(f"📊 [{inf}] NFS-e: Iniciando busca incremental a partir de NSU {last_nsu_nfse}")
         
-        # Loop de busca incremental
-        ult_nsu_nfse = last_nsu_nfse
-        max_iterations = 100
-        iteration_count = 0
+        # Busca concorrente: janela de lotes em voo, ajustada por AIMD a partir
+        # dos 429/Retry-After (modules/nfse_busca_concorrente). O watermark é
+        # gravado à medida que o prefixo contíguo de lotes é recebido, então
+        # uma interrupção no meio nunca pula documentos.
+        from modules.nfse_busca_concorrente import BuscaNSUConcorrente, controle_compartilhado
         
-        logger.info(f"📋 [{inf}] Iniciando loop NFS-e. NSU inicial: {ult_nsu_nfse}")
+        docs_processados = 0
         
-        while iteration_count < max_iterations:
-            iteration_count += 1
-            logger.info(f"🔄 [{inf}] NFS-e iteração {iteration_count}/{max_iterations}, NSU atual: {ult_nsu_nfse}")
+        def _processar_doc_nfse(nsu, xml_nfse, tipo_doc):
+            nonlocal docs_processados
+            nsu = str(nsu).zfill(15)
+            logger.info(f"📄 [{inf}] NFS-e: Processando NSU={nsu}, tipo={tipo_doc}")
             
-            logger.info(f"🌐 [{inf}] Preparando requisição HTTP NFS-e:")
-            logger.info(f"   📍 Endpoint: Ambiente Nacional NFS-e (Receita Federal)")
-            logger.info(f"   📊 NSU solicitado: {ult_nsu_nfse}")
-            logger.info(f"   🔐 Certificado: {path}")
+            # Valida XML
+            if not nfse_svc.validar_xml(xml_nfse):
+                logger.warning(f"⚠️ [{inf}] NFS-e inválida, NSU={nsu}")
+                return
             
-            # Tenta com 2 tentativas rápidas antes de abandonar o loop
-            resp_nfse = None
-            for _tentativa_nsu in range(2):
+            # Roteia por tipo de documento
+            if tipo_doc == 'Cancelamento':
+                # Atualiza status da NFS-e original; NÃO cria novo registro
                 try:
-                    resp_nfse = nfse_svc.consultar_nsu(ult_nsu_nfse)
-                    break
-                except Exception as _e_nsu:
-                    import requests as _req
-                    if isinstance(_e_nsu, (_req.exceptions.Timeout, _req.exceptions.ConnectionError)):
-                        logger.warning(f"⏱️ [{inf}] NFS-e timeout/erro na tentativa {_tentativa_nsu+1}/2: {_e_nsu}")
-                        if _tentativa_nsu < 1:
-                            import time as _time
-                            _time.sleep(3)
-                            continue
-                        else:
-                            logger.error(f"❌ [{inf}] NFS-e: 2 tentativas esgotadas, abortando loop")
-                            break
-                    else:
-                        raise
-
-            if not resp_nfse:
-                logger.info(f"✅ [{inf}] NFS-e: Sem resposta (fim da fila)")
-                break
-            
-            # Extrai status
-            cStat_nfse, ult_nfse, max_nsu_nfse = nfse_svc.extrair_cstat_nsu(resp_nfse)
-            logger.info(f"📊 [{inf}] NFS-e: cStat={cStat_nfse}, ultNSU={ult_nfse}, maxNSU={max_nsu_nfse}")
+                    _processar_cancelamento_nfse(xml_nfse, nsu, inf, db)
+                    docs_processados += 1
+                except Exception as e:
+                    logger.error(f"❌ [{inf}] Erro ao processar cancelamento NFS-e NSU={nsu}: {e}")
+                return
             
-            if cStat_nfse == '656':
-                logger.warning(f"🔒 [{inf}] NFS-e: Erro 656 - Consumo indevido")
-                logger.warning(f"⚠️ [{inf}] NFS-e: NSU mantido em {ult_nsu_nfse}")
-                logger.info(f"   ⏰ Bloqueio - aguarde 65 minutos")
-                break
+            if tipo_doc not in ('NFS-e', 'NFS-E'):
+                # Substituição, Desconhecido, Outros — apenas registra no log
+                logger.info(f"ℹ️ [{inf}] NFS-e: tipo '{tipo_doc}' não processado (NSU={nsu})")
+                return
             
-            if cStat_nfse == '137':
+            # NFS-e regular: salva/atualiza no banco e disco
+            try:
+                salvar_nfse_detalhada(xml_nfse, nsu, inf)
+                logger.info(f"✅ [{inf}] NFS-e processada com sucesso, NSU={nsu}")
+                docs_processados += 1
+            except Exception as e:
+                logger.error(f"❌ [{inf}] Erro ao processar NFS-e NSU={nsu}: {e}")
+        
+        def _avancar_nsu_nfse(watermark):
+            db.set_last_nsu_nfse(inf, str(watermark).zfill(15))
+        
+        ult_nsu_nfse = int(last_nsu_nfse or 0)
+        logger.info(f"📋 [{inf}] Iniciando busca NFS-e. NSU inicial: {ult_nsu_nfse:015d}")
+        logger.info(f"   📍 Endpoint: Ambiente Nacional NFS-e (Receita Federal)")
+        logger.info(f"   🔐 Certificado: {path}")
+        
+        busca = BuscaNSUConcorrente(nfse_svc.consultar_lote_nsu,
+                                    ao_receber=_processar_doc_nfse,
+                                    ao_avancar=_avancar_nsu_nfse,
+                                    controle=controle_compartilhado())
+        resultado = busca.executar(ult_nsu_nfse)
+        
+        logger.info(f"📊 [{inf}] NFS-e: {docs_processados}/{resultado.documentos} documentos processados em "
+                    f"{resultado.requisicoes} requisições ({resultado.limitadas} limitadas por 429, "
+                    f"janela final {busca.controle.limite})")
+        if resultado.watermark != ult_nsu_nfse:
+            logger.info(f"✅ [{inf}] NFS-e: NSU atualizado de {ult_nsu_nfse:015d} → {resultado.watermark:015d}")
+        
+        if resultado.bloqueado:
+            logger.warning(f"🔒 [{inf}] NFS-e: Erro 656 - Consumo indevido")
+            logger.warning(f"⚠️ [{inf}] NFS-e: NSU mantido em {resultado.watermark:015d}")
+            logger.info(f"   ⏰ Bloqueio - aguarde 65 minutos")
+        elif resultado.erro:
+            logger.error(f"❌ [{inf}] NFS-e: busca interrompida ({resultado.erro}); "
+                         f"retoma do NSU {resultado.watermark:015d} no próximo ciclo")
+        elif resultado.chegou_ao_fim:
+            if resultado.documentos == 0:
                 logger.info(f"✅ [{inf}] NFS-e: Nenhum documento novo (cStat=137)")
                 db.registrar_sem_documentos_nfse(inf)
-                break
-            
-            # Extrai e processa documentos NFS-e
-            logger.info(f"📦 [{inf}] NFS-e: Extraindo documentos...")
-            docs_processados = 0
-            doc_count = 0
-            maior_nsu_processado = None  # 🔧 fallback de watermark — ver comentário abaixo
-
-            for nsu, xml_nfse, tipo_doc in nfse_svc.extrair_documentos(resp_nfse):
-                doc_count += 1
-                logger.info(f"📄 [{inf}] NFS-e: Processando doc {doc_count}, NSU={nsu}, tipo={tipo_doc}")
-
-                try:
-                    nsu_num = int(nsu)
-                    if maior_nsu_processado is None or nsu_num > maior_nsu_processado:
-                        maior_nsu_processado = nsu_num
-                except (TypeError, ValueError):
-                    pass
-
-                # Valida XML
-                if not nfse_svc.validar_xml(xml_nfse):
-                    logger.warning(f"⚠️ [{inf}] NFS-e inválida, NSU={nsu}")
-                    continue
-
-                # Roteia por tipo de documento
-                if tipo_doc == 'Cancelamento':
-                    # Atualiza status da NFS-e original; NÃO cria novo registro
-                    try:
-                        _processar_cancelamento_nfse(xml_nfse, nsu, inf, db)
-                        docs_processados += 1
-                    except Exception as e:
-                        logger.error(f"❌ [{inf}] Erro ao processar cancelamento NFS-e NSU={nsu}: {e}")
-                    continue
-
-                if tipo_doc not in ('NFS-e', 'NFS-E'):
-                    # Substituição, Desconhecido, Outros — apenas registra no log
-                    logger.info(f"ℹ️ [{inf}] NFS-e: tipo '{tipo_doc}' não processado (NSU={nsu})")
-                    continue
-
-                # NFS-e regular: salva/atualiza no banco e disco
-                try:
-                    salvar_nfse_detalhada(xml_nfse, nsu, inf)
-                    logger.info(f"✅ [{inf}] NFS-e processada com sucesso, NSU={nsu}")
-                    docs_processados += 1
-                except Exception as e:
-                    logger.error(f"❌ [{inf}] Erro ao processar NFS-e NSU={nsu}: {e}")
-                    continue
-
-            logger.info(f"📊 [{inf}] NFS-e: {docs_processados} documentos processados nesta iteração")
-
-            # Atualiza NSU.
-            # 🔧 BUG REAL CORRIGIDO: esta API (GET /contribuintes/DFe/{NSU}) frequentemente
-            # devolve ultNSU="000000000000000" no envelope mesmo quando retorna documentos
-            # reais com NSU próprio cada um (ex.: lote com 45 docs, NSU 103..152, e ainda
-            # assim ultNSU=0). O código antigo só confiava no ultNSU do envelope e, quando
-            # vinha zerado, desistia e quebrava o loop SEM NUNCA avançar o NSU — fazendo o
-            # sistema reprocessar o mesmo lote para sempre e nunca alcançar documentos novos
-            # (era exatamente por isso que NFS-e novas paravam de aparecer). Agora, quando o
-            # envelope não traz um ultNSU confiável mas documentos foram de fato processados,
-            # usa o maior NSU individual visto no lote como novo watermark — mesma lógica
-            # (correta) já usada em consultar_nfse_incremental() (modules/nfse_service.py).
-            if ult_nfse and ult_nfse != "000000000000000":
-                if ult_nfse != ult_nsu_nfse:
-                    logger.info(f"✅ [{inf}] NFS-e: NSU atualizado de {ult_nsu_nfse} → {ult_nfse}")
-                    ult_nsu_nfse = ult_nfse
-                    db.set_last_nsu_nfse(inf, ult_nfse)
-                else:
-                    logger.info(f"🛑 [{inf}] NFS-e: NSU não mudou ({ult_nsu_nfse}), finalizando")
-                    break
-            elif maior_nsu_processado is not None:
-                novo_nsu = str(maior_nsu_processado).zfill(15)
-                if novo_nsu != ult_nsu_nfse:
-                    logger.info(f"✅ [{inf}] NFS-e: ultNSU ausente/zerado na resposta — usando maior NSU "
-                                f"processado no lote como watermark: {ult_nsu_nfse} → {novo_nsu}")
-                    ult_nsu_nfse = novo_nsu
-                    db.set_last_nsu_nfse(inf, novo_nsu)
-                else:
-                    logger.info(f"🛑 [{inf}] NFS-e: NSU não mudou ({ult_nsu_nfse}), finalizando")
-                    break
-            else:
-                logger.warning(f"⚠️ [{inf}] NFS-e: Sem ultNSU na resposta e nenhum documento processado")
-                break
+            logger.info(f"🏁 [{inf}] NFS-e: fila drenada")
+        
+        # DANFSe oficial das NFS-e novas (e pendentes) baixado em segundo plano,
+        # para o duplo clique abrir o PDF local sem chamar a API
+        try:
+            from modules.danfse_prefetch import obter_prefetcher
+            obter_prefetcher(db).enfileirar_pendentes(cert_data)
+        except Exception as e:
+            logger.warning(f"⚠️ [{inf}] NFS-e: pré-download de DANFSe não iniciado: {e}")
         
-        if iteration_count >= max_iterations:
-            logger.warning(f"⚠️ [{inf}] NFS-e: Atingido limite de {max_iterations} iterações")
-        else:
-            logger.info(f"🏁 [{inf}] NFS-e: Loop finalizado após {iteration_count} iterações")
-                
     except Exception as e:
         logger.error(f"❌ [{inf}] ERRO CRÍTICO ao processar NFS-e: {e}")
         logger.exception(f"Erro ao processar NFS-e para {inf}: {e}")
@@ -5366,33 +5306,44 @@ def processar_nfse_abrasf(cert_data, db):
             logger.error(f"[ABRASF] Erro ao criar NFSeService para {cnpj}: {e}")
             return
 
-        from datetime import datetime as _dt, timedelta as _td
-        hoje       = _dt.now()
-        data_final = hoje.strftime('%d/%m/%Y')
-        # Janela de 31 dias — garante que não perde notas entre ciclos
-        data_ini   = (hoje - _td(days=31)).strftime('%d/%m/%Y')
+        from modules.nfse_abrasf_incremental import (
+            consultar_janelas, gravar_watermark, janelas_consulta, ler_watermark,
+            numeros_conhecidos, registrar_vistas,
+        )
+        from modules.schema_migrations import aplicar_migracoes
+        aplicar_migracoes(db_path)
+        cnpj_prestador = re.sub(r'\D', '', cnpj)
 
         total_novas = 0
 
         for provedor, cod_mun, insc_mun, url_custom in rows:
-            logger.info(f"[ABRASF] Consultando {provedor} — município {cod_mun}...")
-
-            try:
-                resultado = svc.buscar_ginfes(cod_mun, insc_mun or '', data_ini, data_final)
-            except Exception as e:
-                logger.error(f"[ABRASF] Erro na consulta {provedor}/{cod_mun}: {e}")
-                continue
-
-            status = resultado.get('status', 'erro')
-            notas  = resultado.get('notas', [])
-
-            if status == 'erro':
-                logger.warning(f"[ABRASF] {provedor}/{cod_mun}: {resultado.get('mensagem','erro desconhecido')}")
+            # Watermark por (CNPJ, provedor, município) — só o período novo
+            # (com sobreposição) é consultado; carga inicial em janelas paralelas
+            with _sq.connect(db_path) as _conn:
+                ultima_data = ler_watermark(_conn, cnpj, provedor, cod_mun)
+            janelas = janelas_consulta(ultima_data)
+            logger.info(f"[ABRASF] Consultando {provedor} — município {cod_mun} "
+                        f"({janelas[0][0]:%d/%m/%Y} a {janelas[-1][1]:%d/%m/%Y}, "
+                        f"{len(janelas)} janela(s))...")
+
+            notas, coberto_ate, erros = consultar_janelas(
+                lambda ini, fim: svc.buscar_ginfes(cod_mun, insc_mun or '', ini, fim), janelas)
+            for erro in erros:
+                logger.warning(f"[ABRASF] {provedor}/{cod_mun}: {erro}")
+            if coberto_ate is None:
                 continue
 
-            logger.info(f"[ABRASF] {provedor}/{cod_mun}: {len(notas)} nota(s) retornada(s)")
-
-            for nota in notas:
+            # Descarta notas já recebidas antes de qualquer parse/gravação
+            with _sq.connect(db_path) as _conn:
+                conhecidos = numeros_conhecidos(_conn, cod_mun, cnpj_prestador,
+                                                (n.get('numero', '') for n in notas))
+            novas_notas = [n for n in notas if n.get('numero') and str(n['numero']) not in conhecidos]
+            logger.info(f"[ABRASF] {provedor}/{cod_mun}: {len(notas)} nota(s) retornada(s), "
+                        f"{len(novas_notas)} ainda não vista(s)")
+
+            vistas = []
+            falhas = 0
+            for nota in novas_notas:
                 xml_str = nota.get('xml', '')
                 numero  = nota.get('numero', '')
                 if not xml_str or not numero:
@@ -5400,13 +5351,21 @@ def processar_nfse_abrasf(cert_data, db):
                 try:
                     nova = _salvar_nfse_abrasf(xml_str.encode('utf-8') if isinstance(xml_str, str) else xml_str,
                                                inf, numero, db)
+                    vistas.append(str(numero))
                     if nova:
                         total_novas += 1
                 except Exception as e:
+                    falhas += 1
                     logger.error(f"[ABRASF] Erro ao salvar NFS-e {numero}: {e}")
                     from modules.log_categorias import log_falha
                     log_falha('nfse', documento=f"ABRASF numero={numero}", cnpj=inf, erro=e)
 
+            with _sq.connect(db_path) as _conn:
+                registrar_vistas(_conn, cod_mun, cnpj_prestador, vistas)
+                # Nota que falhou ao salvar precisa voltar na próxima consulta
+                if not falhas:
+                    gravar_watermark(_conn, cnpj, provedor, cod_mun, coberto_ate)
+
         logger.info(f"[ABRASF] {cnpj}: {total_novas} NFS-e nova(s) salva(s)")
 
     except Exception as e:
@@ -5448,8 +5407,11 @@ def consultar_nfe_por_chave(chave: str, certificado_path: str, senha: str, cnpj:
             logger.error(f"  ❌ Certificado não encontrado: {certificado_path}")
             return None
         
-        svc = NFeService(certificado_path, senha, cnpj, cuf)
-        prot_xml = svc.fetch_prot_nfe(chave)
+        # Sessão quente + respostas recentes reaproveitadas (sem montar NFeService/WSDL)
+        prot_xml = next(
+            (xml for _, xml in consultar_protocolos_lote([chave], certificado_path, senha, cnpj)),
+            None
+        )
         
         if not prot_xml:
             logger.warning(f"Nenhuma resposta obtida para chave {chave}")
@@ -5468,27 +5430,132 @@ def consultar_nfe_por_chave(chave: str, certificado_path: str, senha: str, cnpj:
         return None
 
 
+def _salvar_resumo_completo(db, chave, informante, xml_completo, cstat_resp=''):
+    """
+    Etapa 3 da Fase 1.5: extrai o XML da NF-e do envelope da distribuição e
+    grava como COMPLETO. Retorna False se a resposta ainda não traz a NF-e
+    (só resumo) — o download é reagendado.
+    """
+    _parser = XMLProcessor(informante=informante)
+    cert = db.find_cert_by_cnpj(informante)
+    nome_cert = db.get_cert_nome_by_informante(cert[3] if cert else informante)
+
+    # ── Descompacta envelope: extrai XML da NF-e e NSU do docZip ────
+    # fetch_by_chave_dist retorna o envelope retDistDFeInt completo da
+    # SEFAZ (com <docZip NSU="...">base64+gzip do XML real</docZip>).
+    # É preciso chamar extract_docs() para obter o XML da NF-e e o NSU.
+    nsu_resumo = ''
+    xml_nfe = None
+    try:
+        for _nsu, _xml in _parser.extract_docs(xml_completo):
+            if '<resNFe' not in _xml:
+                nsu_resumo, xml_nfe = _nsu, _xml
+                logger.info(f"✅ [RESUMO] NSU extraído do docZip: {nsu_resumo}")
+                break
+        else:
+            logger.debug(f"[RESUMO] Resposta sem NF-e completa para {chave} (cStat={cstat_resp or '?'})")
+    except Exception as e_ext:
+        logger.warning(f"⚠️ [RESUMO] Falha ao extrair docZip: {e_ext} — tentando fallback")
+
+    # Fallback: só usa a resposta bruta se contiver XML real de NF-e
+    # NUNCA usar envelopes de erro (656, 137, etc.) como fallback
+    if not xml_nfe:
+        if any(tag in xml_completo for tag in ('<nfeProc', '<NFe ', '<procNFe', '<NFeProc')):
+            xml_nfe = xml_completo
+            logger.info(f"✅ [RESUMO] Usando resposta bruta como fallback (contém NF-e válida)")
+        else:
+            return False
+
+    # Se NSU ainda não veio, tenta recuperar do banco (nota salva anteriormente)
+    if not nsu_resumo:
+        try:
+            with db._connect() as conn:
+                row = conn.execute(
+                    "SELECT nsu FROM notas_detalhadas WHERE chave=?", (chave,)
+                ).fetchone()
+            if row and row[0]:
+                nsu_resumo = str(row[0])
+                logger.info(f"✅ [RESUMO] NSU recuperado do banco: {nsu_resumo}")
+        except Exception:
+            pass
+
+    # Salva arquivo XML em disco (XML real da NF-e, não o envelope)
+    resultado = salvar_xml_por_certificado(
+        xml_nfe, informante,
+        pasta_base="xmls", nome_certificado=nome_cert
+    )
+
+    # Registra em xmls_baixados
+    if resultado:
+        caminho_xml = resultado[0] if isinstance(resultado, tuple) else resultado
+        try:
+            with db._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO xmls_baixados "
+                    "(chave, caminho_arquivo, cnpj_cpf, baixado_em) VALUES (?, ?, ?, ?)",
+                    (chave, caminho_xml, informante, datetime.now().isoformat())
+                )
+        except Exception as ex:
+            logger.warning(f"⚠️ [RESUMO] Erro ao registrar em xmls_baixados: {ex}")
+
+        # Registra PDF se gerado
+        if isinstance(resultado, tuple) and len(resultado) >= 2 and resultado[1]:
+            db.atualizar_pdf_path(chave, resultado[1])
+
+    # Extrai detalhes e grava como COMPLETO — passa NSU e XML real
+    nota = extrair_nfe_detalhado(xml_nfe, _parser, db, chave, informante, nsu_documento=nsu_resumo)
+    nota['informante'] = informante
+    nota['xml_status'] = 'COMPLETO'
+    db.salvar_nota_detalhada(nota)
+
+    # 2. Armazenamento externo (single-path legacy)
+    pasta_storage = db.get_config('storage_pasta_base', 'xmls')
+    if pasta_storage and pasta_storage != 'xmls':
+        salvar_xml_por_certificado(
+            xml_nfe, informante,
+            pasta_base=pasta_storage, nome_certificado=nome_cert
+        )
+
+    # 3. Todos os perfis ativos (DominioWeb etc.)
+    salvar_xml_por_certificado(
+        xml_nfe, informante,
+        pasta_base=None, nome_certificado=nome_cert
+    )
+
+    logger.info(
+        f"✅ [RESUMO] {chave} salvo como COMPLETO "
+        f"(nº {nota.get('numero', 'N/A')}, "
+        f"emitente: {nota.get('nome_emitente') or nota.get('cnpj_emitente', 'N/A')})"
+    )
+    return True
+
+
 def baixar_resumos_pendentes(db):
     """
-    Fase 1.5: Para cada NF-e com xml_status='RESUMO' no banco, envia
-    Ciência da Operação (se ainda não enviada) e baixa o XML completo via
-    Distribuição DFe (consChNFe).  Chamada uma vez por ciclo, após a Fase 1.
+    Fase 1.5: Para cada NF-e com xml_status='RESUMO' no banco (ou
+    INDISPONIVEL com nova tentativa vencida), envia Ciência da Operação (se
+    ainda não enviada) e baixa o XML completo via Distribuição DFe
+    (consChNFe). Chamada uma vez por ciclo, após a Fase 1.
+
+    Pipeline por certificado (modules/download_resumos): as Ciências saem em
+    rajada e os downloads são reagendados em intervalos crescentes enquanto
+    a SEFAZ não libera o XML; certificados em paralelo. A nota que não vem
+    fica INDISPONIVEL com data de nova tentativa.
     """
-    import time
+    from modules.download_resumos import (
+        AGUARDAR, BLOQUEADO, ERRO, OK, PERMANENTE, ItemResumo, PipelineResumos,
+        concluir, marcar_indisponivel, pendentes,
+    )
     try:
         from modules.manifestacao_service import ManifestacaoService
     except Exception as e:
         logger.warning(f"⚠️ [RESUMO] ManifestacaoService indisponível: {e} — fase 1.5 ignorada")
         return
 
-    # Consulta RESUMOs pendentes
+    # Consulta RESUMOs pendentes (e INDISPONIVEL com nova tentativa vencida)
     try:
         with db._connect() as conn:
-            rows = conn.execute(
-                "SELECT chave, informante FROM notas_detalhadas "
-                "WHERE xml_status='RESUMO' AND tipo IN ('NFe', 'NF-e') "
-                "ORDER BY data_emissao DESC"
-            ).fetchall()
+            rows = pendentes(conn)
     except Exception as e:
         logger.error(f"❌ [RESUMO] Erro ao consultar RESUMOs pendentes: {e}")
         return
@@ -5499,16 +5566,8 @@ def baixar_resumos_pendentes(db):
 
     logger.info(f"📋 [RESUMO] {len(rows)} NF-e(s) com xml_status=RESUMO — iniciando download automático")
 
-    # Rastreia certificados que atingiram rate-limit (656) neste ciclo.
-    # Chave: cnpj_cert (str). Valor: True = bloqueado.
-    # Quando um cert é bloqueado, todas as notas desse cert são puladas ==
-    # sem novos requests, sem novos WSDLs, sem spammar a SEFAZ.
-    _certs_656: set = set()
-
-    # Cache de NFeService por cnpj_cert para reusar cliente WSDL entre notas.
-    # Evita re-baixar os dois WSDLs (~400 ms) para cada nota individualmente.
-    _svc_cache: dict = {}
-
+    itens = []
+    contexto = {}  # chave → (informante, certificado)
     for chave, informante in rows:
         # Aceita apenas NF-e modelo 55 (posições 20-21 da chave)
         if len(chave) != 44:
@@ -5523,103 +5582,87 @@ def baixar_resumos_pendentes(db):
         if not cert:
             logger.warning(f"⚠️ [RESUMO] Certificado não encontrado para informante {informante}, pulando {chave}")
             continue
+        contexto[chave] = (informante, cert)
+        itens.append(ItemResumo(chave, cert[0],
+                                precisa_ciencia=not db.check_manifestacao_exists(chave, '210210', informante)))
 
-        cnpj_cert, cert_path, cert_senha, inf, cuf = cert
-
-        # Pula todas as notas de um certificado já bloqueado por 656
-        if cnpj_cert in _certs_656:
-            logger.debug(f"⏭️ [RESUMO] Cert {cnpj_cert} bloqueado (656) — pulando {chave}")
-            continue
-
-        # ── Etapa 1: Ciência da Operação (tpEvento=210210) ──────────────────
-        ja_manifestado = db.check_manifestacao_exists(chave, '210210', informante)
-        if not ja_manifestado:
-            logger.info(f"📢 [RESUMO] Enviando Ciência da Operação para {chave}")
+    # Um ManifestacaoService/NFeService por certificado — cada certificado tem
+    # sua própria thread no pipeline; reusa o cliente WSDL entre as notas.
+    _man_cache: dict = {}
+    _svc_cache: dict = {}
+    _ultimo_cstat: dict = {}
+
+    def _servico(cache, cnpj_cert, fabrica):
+        if cnpj_cert not in cache:
+            cache[cnpj_cert] = fabrica()
+        return cache[cnpj_cert]
+
+    # ── Etapa 1: Ciência da Operação (tpEvento=210210) ──────────────────
+    def ciencia(item):
+        informante, (cnpj_cert, cert_path, cert_senha, inf, cuf) = contexto[item.chave]
+        chave = item.chave
+        logger.info(f"📢 [RESUMO] Enviando Ciência da Operação para {chave}")
+        svc_man = _servico(_man_cache, cnpj_cert, lambda: ManifestacaoService(cert_path, cert_senha))
+        sucesso, protocolo, msg, _ = svc_man.enviar_manifestacao(
+            chave=chave,
+            tipo_evento='210210',
+            cnpj_destinatario=informante,
+        )
+        if sucesso:
+            logger.info(f"✅ [RESUMO] Ciência registrada: protocolo={protocolo}")
+            db.register_manifestacao(chave, '210210', informante,
+                                     status='ENVIADA', protocolo=protocolo)
+            return True  # a SEFAZ ainda vai liberar o XML
+        logger.warning(f"⚠️ [RESUMO] Ciência rejeitada: {msg} — tentando download mesmo assim")
+        # cStat 596 = prazo de 10 dias esgotado: Ciência nunca mais será aceita,
+        # mas o XML está disponível livremente na Distribuição DFe após 10 dias.
+        # Persiste no banco para não tentar Ciência novamente nos próximos ciclos.
+        if '596' in str(msg):
             try:
-                svc_man = ManifestacaoService(cert_path, cert_senha)
-                sucesso, protocolo, msg, _ = svc_man.enviar_manifestacao(
-                    chave=chave,
-                    tipo_evento='210210',
-                    cnpj_destinatario=informante,
+                db.register_manifestacao(
+                    chave, '210210', informante,
+                    status='DISPENSADA_596', protocolo=''
                 )
-                if sucesso:
-                    logger.info(f"✅ [RESUMO] Ciência registrada: protocolo={protocolo}")
-                    db.register_manifestacao(chave, '210210', informante,
-                                             status='ENVIADA', protocolo=protocolo)
-                    time.sleep(3)  # Aguarda SEFAZ processar antes de baixar
-                else:
-                    logger.warning(f"⚠️ [RESUMO] Ciência rejeitada: {msg} — tentando download mesmo assim")
-                    # cStat 596 = prazo de 10 dias esgotado: Ciência nunca mais será aceita,
-                    # mas o XML está disponível livremente na Distribuição DFe após 10 dias.
-                    # Persiste no banco para não tentar Ciência novamente nos próximos ciclos.
-                    if '596' in str(msg):
-                        try:
-                            db.register_manifestacao(
-                                chave, '210210', informante,
-                                status='DISPENSADA_596', protocolo=''
-                            )
-                            logger.info(f"📋 [RESUMO] 596 registrado — Ciência não será reenviada nos próximos ciclos")
-                        except Exception:
-                            pass  # UNIQUE constraint já satisfeita, sem problema
-            except Exception as e:
-                logger.error(f"❌ [RESUMO] Erro ao enviar Ciência para {chave}: {e}")
-                # Prossegue mesmo com falha na manifestação
-        else:
-            logger.debug(f"✅ [RESUMO] Ciência já registrada anteriormente para {chave}")
-
-        # ── Etapa 2: Download do XML completo via Distribuição DFe ──────────
-        # Reutiliza NFeService já inicializado para este certificado (evita re-download de WSDL)
-        if cnpj_cert not in _svc_cache:
-            try:
-                _svc_cache[cnpj_cert] = NFeService(cert_path, cert_senha, cnpj_cert, cuf)
-            except Exception as e:
-                logger.error(f"❌ [RESUMO] Não foi possível inicializar NFeService para {chave}: {e}")
-                continue
-        svc_nfe = _svc_cache[cnpj_cert]
+                logger.info(f"📋 [RESUMO] 596 registrado — Ciência não será reenviada nos próximos ciclos")
+            except Exception:
+                pass  # UNIQUE constraint já satisfeita, sem problema
+        return False
 
-        logger.info(f"⬇️  [RESUMO] Baixando XML completo: {chave}")
+    # ── Etapa 2: Download do XML completo via Distribuição DFe ──────────
+    def baixar(item):
+        informante, (cnpj_cert, cert_path, cert_senha, inf, cuf) = contexto[item.chave]
+        chave = item.chave
         try:
-            xml_completo = svc_nfe.fetch_by_chave_dist(chave)
+            svc_nfe = _servico(_svc_cache, cnpj_cert, lambda: NFeService(cert_path, cert_senha, cnpj_cert, cuf))
         except Exception as e:
-            logger.error(f"❌ [RESUMO] Erro em fetch_by_chave_dist para {chave}: {e}")
-            continue
+            logger.error(f"❌ [RESUMO] Não foi possível inicializar NFeService para {chave}: {e}")
+            return ERRO
 
+        logger.info(f"⬇️  [RESUMO] Baixando XML completo: {chave}")
+        xml_completo = svc_nfe.fetch_by_chave_dist(chave)
         if not xml_completo:
             logger.warning(f"⚠️ [RESUMO] Sem XML retornado para {chave} — será tentado no próximo ciclo")
-            continue
+            return ERRO
 
         # Verifica cStat da resposta SEFAZ antes de processar
         # Se for erro (ex: 656=rate limit, 137=não localizado) não marca como COMPLETO
-        _cstat_resp = ''
-        try:
-            import re as _re
-            _m = _re.search(r'<cStat>(\d+)</cStat>', xml_completo)
-            _cstat_resp = _m.group(1) if _m else ''
-        except Exception:
-            pass
+        _m = re.search(r'<(?:\w+:)?cStat>(\d+)</(?:\w+:)?cStat>', xml_completo)
+        _cstat_resp = _m.group(1) if _m else ''
+        _ultimo_cstat[chave] = _cstat_resp
 
         if _cstat_resp == '656':
-            logger.warning(
-                f"⚠️ [RESUMO] Rate limit SEFAZ (656) para cert {cnpj_cert} — "
-                f"bloqueando certificado para o resto deste ciclo"
-            )
-            _certs_656.add(cnpj_cert)
-            continue
+            return BLOQUEADO
         if _cstat_resp == '137':
-            logger.warning(f"⚠️ [RESUMO] Documento não localizado na distribuição (137) para {chave} — pode não ser destinatário")
-            continue
+            logger.info(f"⏳ [RESUMO] Documento ainda não localizado na distribuição (137) para {chave}")
+            return AGUARDAR
         # Rejeições da DistribuiçãoDFe — 632=fora do prazo  633=inexistente  634=inutilizada
         # 653=NF-e cancelada, arquivo indisponível (não recuperável via NFeConsultaProtocolo4 —
         #      retorna apenas protNFe sem infNFe; vai direto para INDISPONIVEL).
         # Para cStat 632: a NF-e pode ainda existir no NFeConsultaProtocolo4 (sem limite de 60 dias).
         # Tentamos fetch_prot_nfe antes de desistir e marcar como INDISPONIVEL.
         if _cstat_resp in ('632', '633', '634', '653'):
-            _xmotivo_str = ''
-            try:
-                _m2 = __import__('re').search(r'<xMotivo>([^<]+)</xMotivo>', xml_completo)
-                _xmotivo_str = _m2.group(1) if _m2 else ''
-            except Exception:
-                pass
+            _m2 = re.search(r'<(?:\w+:)?xMotivo>([^<]+)</(?:\w+:)?xMotivo>', xml_completo)
+            _xmotivo_str = _m2.group(1) if _m2 else ''
 
             xml_via_prot = None
             if _cstat_resp == '632':
@@ -5632,11 +5675,7 @@ def baixar_resumos_pendentes(db):
                 except Exception as _e_prot:
                     logger.debug(f"[RESUMO] fetch_prot_nfe após 632 falhou: {_e_prot}")
 
-            if xml_via_prot:
-                # Sucesso — continua processamento como COMPLETO
-                xml_completo = xml_via_prot
-                # Pula direto para a etapa 3 (reatribui xml_completo e cai no fluxo normal abaixo)
-            else:
+            if not xml_via_prot:
                 logger.warning(
                     f"🚫 [RESUMO] Rejeição permanente cStat={_cstat_resp} ({_xmotivo_str}) para {chave} "
                     f"— marcando como INDISPONIVEL (não será tentado novamente)"
@@ -5657,108 +5696,38 @@ def baixar_resumos_pendentes(db):
                             )
                 except Exception as _e_ind:
                     logger.warning(f"⚠️ [RESUMO] Erro ao marcar INDISPONIVEL: {_e_ind}")
-                continue
+                return PERMANENTE
+            # Sucesso — continua processamento como COMPLETO
+            xml_completo = xml_via_prot
 
         # ── Etapa 3: Processar e salvar como COMPLETO ───────────────────────
         try:
-            _parser = XMLProcessor(informante=informante)
-            nome_cert = db.get_cert_nome_by_informante(inf)
-
-            # ── Descompacta envelope: extrai XML da NF-e e NSU do docZip ────
-            # fetch_by_chave_dist retorna o envelope retDistDFeInt completo da
-            # SEFAZ (com <docZip NSU="...">base64+gzip do XML real</docZip>).
-            # É preciso chamar extract_docs() para obter o XML da NF-e e o NSU.
-            nsu_resumo = ''
-            xml_nfe = None
-            try:
-                docs = _parser.extract_docs(xml_completo)
-                if docs:
-                    nsu_resumo, xml_nfe = docs[0]
-                    logger.info(f"✅ [RESUMO] NSU extraído do docZip: {nsu_resumo}")
-                else:
-                    logger.warning(f"⚠️ [RESUMO] extract_docs vazio para {chave} — resposta SEFAZ sem docZip (cStat={_cstat_resp or '?'})")
-            except Exception as e_ext:
-                logger.warning(f"⚠️ [RESUMO] Falha ao extrair docZip: {e_ext} — tentando fallback")
-
-            # Fallback: só usa a resposta bruta se contiver XML real de NF-e
-            # NUNCA usar envelopes de erro (656, 137, etc.) como fallback
-            if not xml_nfe:
-                if any(tag in xml_completo for tag in ('<nfeProc', '<NFe ', '<procNFe', '<NFeProc')):
-                    xml_nfe = xml_completo
-                    logger.info(f"✅ [RESUMO] Usando resposta bruta como fallback (contém NF-e válida)")
-                else:
-                    logger.warning(
-                        f"⚠️ [RESUMO] Resposta SEFAZ sem NF-e válida para {chave} "
-                        f"(cStat={_cstat_resp or '?'}) — tentando no próximo ciclo"
-                    )
-                    continue
-
-            # Se NSU ainda não veio, tenta recuperar do banco (nota salva anteriormente)
-            if not nsu_resumo:
-                try:
-                    with db._connect() as conn:
-                        row = conn.execute(
-                            "SELECT nsu FROM notas_detalhadas WHERE chave=?", (chave,)
-                        ).fetchone()
-                    if row and row[0]:
-                        nsu_resumo = str(row[0])
-                        logger.info(f"✅ [RESUMO] NSU recuperado do banco: {nsu_resumo}")
-                except Exception:
-                    pass
-
-            # Salva arquivo XML em disco (XML real da NF-e, não o envelope)
-            resultado = salvar_xml_por_certificado(
-                xml_nfe, informante,
-                pasta_base="xmls", nome_certificado=nome_cert
-            )
-
-            # Registra em xmls_baixados
-            if resultado:
-                caminho_xml = resultado[0] if isinstance(resultado, tuple) else resultado
-                try:
-                    with db._connect() as conn:
-                        conn.execute(
-                            "INSERT OR REPLACE INTO xmls_baixados "
-                            "(chave, caminho_arquivo, cnpj_cpf, baixado_em) VALUES (?, ?, ?, ?)",
-                            (chave, caminho_xml, informante, datetime.now().isoformat())
-                        )
-                except Exception as ex:
-                    logger.warning(f"⚠️ [RESUMO] Erro ao registrar em xmls_baixados: {ex}")
-
-                # Registra PDF se gerado
-                if isinstance(resultado, tuple) and len(resultado) >= 2 and resultado[1]:
-                    db.atualizar_pdf_path(chave, resultado[1])
-
-            # Extrai detalhes e grava como COMPLETO — passa NSU e XML real
-            nota = extrair_nfe_detalhado(xml_nfe, _parser, db, chave, informante, nsu_documento=nsu_resumo)
-            nota['informante'] = informante
-            nota['xml_status'] = 'COMPLETO'
-            db.salvar_nota_detalhada(nota)
-
-            # 2. Armazenamento externo (single-path legacy)
-            pasta_storage = db.get_config('storage_pasta_base', 'xmls')
-            if pasta_storage and pasta_storage != 'xmls':
-                salvar_xml_por_certificado(
-                    xml_nfe, informante,
-                    pasta_base=pasta_storage, nome_certificado=nome_cert
-                )
-
-            # 3. Todos os perfis ativos (DominioWeb etc.)
-            salvar_xml_por_certificado(
-                xml_nfe, informante,
-                pasta_base=None, nome_certificado=nome_cert
-            )
-
-            logger.info(
-                f"✅ [RESUMO] {chave} salvo como COMPLETO "
-                f"(nº {nota.get('numero', 'N/A')}, "
-                f"emitente: {nota.get('nome_emitente') or nota.get('cnpj_emitente', 'N/A')})"
-            )
-
+            if _salvar_resumo_completo(db, chave, informante, xml_completo, _cstat_resp):
+                return OK
         except Exception as e:
             logger.error(f"❌ [RESUMO] Erro ao processar XML completo de {chave}: {e}", exc_info=True)
+            return ERRO
+        logger.info(f"⏳ [RESUMO] SEFAZ ainda não liberou o XML de {chave} (cStat={_cstat_resp or '?'})")
+        return AGUARDAR
+
+    finais = PipelineResumos(ciencia, baixar).executar(itens)
+
+    # Agenda: baixadas/definitivas saem; as que não vieram ficam INDISPONIVEL com nova data
+    try:
+        with db._connect() as conn:
+            for chave, situacao in finais.items():
+                if situacao in (OK, PERMANENTE):
+                    concluir(conn, chave)
+                elif situacao == AGUARDAR:
+                    proxima = marcar_indisponivel(conn, chave, contexto[chave][0], _ultimo_cstat.get(chave, ''))
+                    quando = datetime.fromtimestamp(proxima).strftime('%d/%m %H:%M') if proxima else 'nunca'
+                    logger.info(f"🕒 [RESUMO] {chave} sem XML liberado — INDISPONIVEL, nova tentativa: {quando}")
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"⚠️ [RESUMO] Erro ao atualizar a agenda de download: {e}")
 
-    logger.info("✅ [RESUMO] Fase 1.5 concluída")
+    contagem = {s: list(finais.values()).count(s) for s in (OK, AGUARDAR, BLOQUEADO, PERMANENTE, ERRO)}
+    logger.info(f"✅ [RESUMO] Fase 1.5 concluída: {contagem}")
 
 
 def baixar_ctes_pendentes(db):
@@ -5959,6 +5928,9 @@ def run_single_cycle():
         logger.info(f"=== Início da busca: {datetime.now().isoformat()} ===")
         logger.info(f"Diretório de dados: {data_dir}")
         
+        # 0) Pedidos feitos sem conexão desde o último ciclo
+        drenar_fila_offline(db)
+        
         # 1) Distribuição - NFe, CTe E NFSe de TODOS os certificados
         logger.info("📥 Fase 1: Buscando documentos (NFe, CT-e e NFS-e) de todos os certificados...")
         for cnpj, path, senha, inf, cuf in db.get_certificados():
@@ -6187,6 +6159,7 @@ UF: {cuf}
                                     logger.info(f"💾 [{cnpj}] Evento salvo na pasta Eventos/")
                                     
                                     # Registra caminho do PDF se foi gerado
+                                    caminho_xml = resultado
                                     if isinstance(resultado, tuple):
                                         caminho_xml, caminho_pdf = resultado
                                         if caminho_pdf:
@@ -6197,8 +6170,8 @@ UF: {cuf}
                                     if pasta_storage and pasta_storage != 'xmls':
                                         salvar_xml_por_certificado(xml, cnpj, pasta_base=pasta_storage, nome_certificado=nome_cert)
                                     
-                                    # Processa o evento (atualiza status da nota se for cancelamento, etc)
-                                    processar_evento_status(xml, chave, db)
+                                    # Indexa o evento e atualiza o status da nota (cancelamento, CC-e)
+                                    processar_evento_status(xml, chave, db, caminho_xml, inf)
                                     
                                     # Registra manifestação no banco (se for manifestação do destinatário)
                                     if tpEvento and tpEvento.startswith('2102'):  # Manifestações: 210200, 210210, 210220, 210240
@@ -6625,6 +6598,342 @@ UF: {cuf}
         raise
 
 
+# -------------------------------------------------------------------
+# Busca por chave (modules/busca_chaves_lote)
+# -------------------------------------------------------------------
+CSTAT_AUTORIZADOS = ('100', '101', '110', '150', '301', '302')
+CSTAT_OUTRO_CERTIFICADO = ('217', '226', '404', '137')
+
+
+def _cstat_resposta(resp_xml: str) -> str:
+    m = re.search(r'<(?:\w+:)?cStat>(\d+)</(?:\w+:)?cStat>', resp_xml or '')
+    return m.group(1) if m else ''
+
+
+def _documento_da_distribuicao(resp_xml, marcadores):
+    """Primeiro docZip da resposta de distribuição que contém um dos marcadores."""
+    if not resp_xml:
+        return '', None
+    if any(m in resp_xml for m in marcadores) and '<docZip' not in resp_xml:
+        return '', resp_xml
+    try:
+        docs = XMLProcessor().extract_docs(resp_xml)
+    except Exception as e:
+        logger.debug(f"Resposta de distribuição sem docZip legível: {e}")
+        return '', None
+    for nsu, xml_doc in docs:
+        if any(m in xml_doc for m in marcadores):
+            return nsu, xml_doc
+    return '', None
+
+
+def buscar_documento_por_chave(svc, chave: str, cnpj_cert: str, resp_prot_cte: str = None):
+    """
+    Consulta UMA chave com UM certificado (svc = NFeService do certificado).
+
+    NF-e: Distribuição DFe por chave (vale para emitente e destinatário); se
+    não vier e o certificado for o emitente, ConsultaProtocolo para saber a
+    situação. CT-e: protocolo (às vezes com o CT-e embutido), depois a
+    distribuição; autorizado sem XML disponível volta como RESUMO.
+
+    Returns:
+        ResultadoChave (modules/busca_chaves_lote) — o documento não é salvo aqui.
+    """
+    from modules.busca_chaves_lote import (
+        BLOQUEADO, ERRO, FALHA, OK, OUTRO_CERTIFICADO, RESUMO, ResultadoChave,
+    )
+    cnpj_cert = ''.join(c for c in (cnpj_cert or '') if c.isdigit())
+
+    if chave[20:22] != '57':
+        resp = svc.fetch_by_chave_dist(chave)
+        if not resp:
+            return ResultadoChave(chave, ERRO, mensagem="Distribuição DFe sem resposta")
+        cstat = _cstat_resposta(resp)
+        if cstat == '656':
+            return ResultadoChave(chave, BLOQUEADO, mensagem="Consumo indevido (656)")
+        if cstat == '138':
+            nsu, xml_doc = _documento_da_distribuicao(resp, ('<nfeProc', '<procNFe', '<NFe'))
+            if xml_doc:
+                return ResultadoChave(chave, OK, xml=xml_doc, dados={'nsu': nsu})
+            return ResultadoChave(chave, FALHA, mensagem="Distribuição retornou 138 mas sem XML válido no docZip")
+        if cnpj_cert != chave[6:20]:
+            # Não é o emitente e a distribuição não tem o documento para este CNPJ
+            return ResultadoChave(chave, OUTRO_CERTIFICADO, mensagem=f"Distribuição: cStat={cstat or '?'}")
+        resp_prot = svc.fetch_prot_nfe(chave)
+        cstat_prot = _cstat_resposta(resp_prot)
+        if not resp_prot:
+            return ResultadoChave(chave, ERRO, mensagem="ConsultaProtocolo sem resposta")
+        if cstat_prot in CSTAT_OUTRO_CERTIFICADO:
+            return ResultadoChave(chave, OUTRO_CERTIFICADO, mensagem=f"Protocolo: cStat={cstat_prot}")
+        motivo = (re.search(r'<(?:\w+:)?xMotivo>([^<]*)<', resp_prot) or [None, ''])[1]
+        return ResultadoChave(chave, FALHA, dados={'cStat': cstat_prot, 'xMotivo': motivo},
+                              mensagem=(f"autorizado ({cstat_prot}) mas XML completo não disponível"
+                                        if cstat_prot in CSTAT_AUTORIZADOS else f"{cstat_prot} - {motivo}"))
+
+    # CT-e
+    resp = resp_prot_cte or svc.fetch_prot_cte(chave)
+    if not resp:
+        return ResultadoChave(chave, ERRO, mensagem="Consulta de CT-e sem resposta")
+    ns = {'cte': 'http://www.portalfiscal.inf.br/cte'}
+    tree = etree.fromstring(resp.encode('utf-8') if isinstance(resp, str) else resp)
+    prot = tree.find('.//cte:protCTe', namespaces=ns)
+    if prot is None:
+        cstat = tree.findtext('.//cte:cStat', namespaces=ns) or ''
+        motivo = tree.findtext('.//cte:xMotivo', namespaces=ns) or 'Protocolo CT-e não encontrado'
+        situacao = OUTRO_CERTIFICADO if cstat in CSTAT_OUTRO_CERTIFICADO else FALHA
+        return ResultadoChave(chave, situacao, mensagem=f"{cstat} - {motivo}")
+    cstat = prot.findtext('cte:infProt/cte:cStat', namespaces=ns) or ''
+    motivo = prot.findtext('cte:infProt/cte:xMotivo', namespaces=ns) or ''
+    dados = {'cStat': cstat, 'xMotivo': motivo}
+    if cstat not in CSTAT_AUTORIZADOS:
+        situacao = OUTRO_CERTIFICADO if cstat in CSTAT_OUTRO_CERTIFICADO else FALHA
+        return ResultadoChave(chave, situacao, mensagem=f"{cstat} - {motivo}", dados=dados)
+
+    # Tier 1: o retConsSitCTe de algumas SEFAZ já embute o CT-e
+    cte_elem = tree.find('.//cte:CTe', namespaces=ns)
+    if cte_elem is not None:
+        xml_doc = ('<cteProc versao="4.00" xmlns="http://www.portalfiscal.inf.br/cte">'
+                   + etree.tostring(cte_elem, encoding='unicode')
+                   + etree.tostring(prot, encoding='unicode') + '</cteProc>')
+        return ResultadoChave(chave, OK, xml=xml_doc, dados=dados)
+    # Tier 2: distribuição por chave
+    try:
+        nsu, xml_doc = _documento_da_distribuicao(svc.fetch_by_chave_dist(chave), ('<cteProc', '<CTe'))
+    except Exception as e:
+        logger.debug(f"[BUSCA-CHAVE] Distribuição do CT-e {chave} falhou: {e}")
+        nsu, xml_doc = '', None
+    if xml_doc:
+        dados['nsu'] = nsu
+        return ResultadoChave(chave, OK, xml=xml_doc, dados=dados)
+    # Tier 3: autorizado, mas só os dados do protocolo/chave
+    nome_emit = tree.findtext('.//cte:xNome', namespaces=ns) or ''
+    aamm = chave[2:6]
+    dados['resumo'] = {
+        'chave': chave, 'tipo': 'CTe', 'numero': str(int(chave[25:34])),
+        'data_emissao': f"20{aamm[:2]}-{aamm[2:4]}-01", 'cnpj_emitente': chave[6:20],
+        'nome_emitente': nome_emit, 'status': motivo, 'xml_status': 'RESUMO', 'uf': chave[:2],
+        'nsu': '', 'atualizado_em': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    return ResultadoChave(chave, RESUMO, dados=dados, mensagem="CT-e autorizado; XML completo indisponível")
+
+
+def salvar_documento_por_chave(db, chave: str, xml_doc: str, cert, nsu: str = '') -> dict:
+    """Grava o documento obtido por chave: xmls/, perfis ativos, xmls_baixados e notas_detalhadas."""
+    cnpj, _path, _senha, inf, _cuf = cert
+    nome_cert = db.get_cert_nome_by_informante(inf)
+    resultado = salvar_xml_por_certificado(xml_doc, cnpj, pasta_base="xmls", nome_certificado=nome_cert)
+    caminho_xml = resultado[0] if isinstance(resultado, tuple) else resultado
+    if caminho_xml:
+        db.registrar_xml(chave, cnpj, caminho_xml)
+    else:
+        db.registrar_xml(chave, cnpj)
+    salvar_xml_por_certificado(xml_doc, cnpj, pasta_base=None, nome_certificado=nome_cert)
+    nota = extrair_nota_detalhada(xml_doc, XMLProcessor(informante=inf), db, chave, inf, nsu_documento=nsu)
+    nota['informante'] = inf
+    nota['xml_status'] = 'COMPLETO'
+    db.salvar_nota_detalhada(nota)
+    if isinstance(resultado, tuple) and len(resultado) >= 2 and resultado[1]:
+        db.atualizar_pdf_path(chave, resultado[1])
+    return nota
+
+
+def busca_chaves_lote(db, chaves, max_por_certificado=None, bloqueados_cnpj=()):
+    """
+    Busca por chave em lote já ligada ao banco: tira as chaves já baixadas,
+    roteia pelo dono conhecido/emitente/UF, consulta os certificados em
+    paralelo e salva cada documento assim que chega.
+
+    Args:
+        bloqueados_cnpj: CNPJs em cooldown 656 conhecidos pelo chamador; os
+            registrados em erro_656 também ficam fora do lote.
+
+    Returns:
+        (motor, resultados) — resultados é um iterador de ResultadoChave na
+        ordem em que ficam prontos; motor.cancelar() / motor.lista_retentativa().
+    """
+    import threading
+    from modules.busca_chaves_lote import (
+        BLOQUEADO, MAX_POR_CERTIFICADO, OK, RESUMO, BuscaChavesLote, donos_conhecidos,
+        ja_baixadas, normalizar_chaves, rotear,
+    )
+
+    chaves = normalizar_chaves(chaves)
+    certificados = db.get_certificados()
+    with db._connect() as conn:
+        baixadas = ja_baixadas(conn, chaves)
+        donos = donos_conhecidos(conn, chaves)
+
+    bloqueados_cnpj = {''.join(c for c in cnpj if c.isdigit()) for cnpj in bloqueados_cnpj}
+    bloqueados = [i for i, (cnpj, _p, _s, inf, _c) in enumerate(certificados)
+                  if ''.join(c for c in cnpj if c.isdigit()) in bloqueados_cnpj
+                  or not db.pode_consultar_certificado(inf, db.get_last_nsu(inf))]
+
+    servicos = {}
+    servicos_lock = threading.Lock()
+
+    def _servico(indice):
+        # requests.Session não é thread-safe: um NFeService por certificado e thread
+        chave_svc = (indice, threading.get_ident())
+        with servicos_lock:
+            svc = servicos.get(chave_svc)
+        if svc is None:
+            cnpj, path, senha, inf, cuf = certificados[indice]
+            svc = NFeService(path, senha, cnpj, cuf)
+            with servicos_lock:
+                servicos[chave_svc] = svc
+        return svc
+
+    # CT-e: protocolos em lote (sessão quente por UF) para o primeiro certificado de cada chave
+    protocolos_cte = {}
+    chaves_cte = {}
+    for chave in chaves:
+        if chave[20:22] == '57' and chave not in baixadas:
+            chaves_cte.setdefault(rotear(chave, certificados, donos.get(chave))[0], []).append(chave)
+    for indice, lista in chaves_cte.items():
+        cnpj, path, senha, inf, cuf = certificados[indice]
+        try:
+            for chave, xml in consultar_protocolos_lote(lista, path, senha, cnpj):
+                if xml:
+                    protocolos_cte[(indice, chave)] = xml
+        except Exception as e:
+            logger.warning(f"⚠️ [BUSCA-CHAVE] Protocolos de CT-e em lote falharam, seguindo chave a chave: {e}")
+
+    def buscar(chave, indice):
+        resultado = buscar_documento_por_chave(
+            _servico(indice), chave, certificados[indice][0],
+            resp_prot_cte=protocolos_cte.pop((indice, chave), None),
+        )
+        if resultado.situacao == BLOQUEADO:
+            # Mesmo bloqueio do ciclo NSU: a SEFAZ conta o consumo por CNPJ
+            inf = certificados[indice][3]
+            db.registrar_erro_656(inf, db.get_last_nsu(inf))
+        if resultado.dados.get('cStat'):
+            db.set_nf_status(chave, resultado.dados['cStat'], resultado.dados.get('xMotivo', ''))
+        if resultado.situacao == OK:
+            nota = salvar_documento_por_chave(db, chave, resultado.xml, certificados[indice],
+                                              nsu=resultado.dados.get('nsu', ''))
+            resultado.dados['nota'] = nota
+            resultado.xml = None  # já está em disco; não segura milhares de XMLs na memória
+        elif resultado.situacao == RESUMO:
+            resumo = dict(resultado.dados['resumo'], informante=certificados[indice][3])
+            db.salvar_nota_detalhada(resumo)
+        return resultado
+
+    motor = BuscaChavesLote(certificados, buscar,
+                            max_por_certificado=max_por_certificado or MAX_POR_CERTIFICADO,
+                            bloqueados=bloqueados)
+    return motor, motor.executar(chaves, donos=donos, ja_baixadas=baixadas)
+
+
+# -------------------------------------------------------------------
+# Fila offline (modules/fila_offline)
+# -------------------------------------------------------------------
+ESPERA_COOLDOWN_656 = 3900  # 65 minutos, mesmo bloqueio do ciclo NSU
+_reprodutores_fila = {}
+
+
+def sonda_conectividade(timeout: float = 5) -> bool:
+    """SEFAZ alcançável? Respeita o disjuntor da Distribuição DFe e abre um TCP na porta 443."""
+    import socket
+    from urllib.parse import urlsplit
+    if not saude_endpoints().disponivel(URL_DISTRIBUICAO):
+        return False
+    try:
+        socket.create_connection((urlsplit(URL_DISTRIBUICAO).hostname, 443), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def executores_fila(db):
+    """Executores dos pedidos da fila offline, um por tipo, sobre o banco `db`."""
+    servicos = {}  # NFeService por certificado (reaproveita WSDL/sessão entre pedidos)
+
+    def _certificado(informante):
+        cert = db.find_cert_by_cnpj(informante)
+        if not cert:
+            raise Rejeitada(f"Certificado do informante {informante} não cadastrado")
+        return cert
+
+    def manifestar(item):
+        from modules.manifestacao_service import ManifestacaoService
+        cnpj, path, senha, inf, cuf = _certificado(item.informante)
+        tipo_evento = item.payload.get('tipo_evento')
+        svc = ManifestacaoService(path, senha)
+        sucesso, protocolo, mensagem, _ = svc.enviar_manifestacao(
+            chave=item.chave,
+            tipo_evento=tipo_evento,
+            cnpj_destinatario=item.payload.get('cnpj_destinatario') or cnpj,
+            justificativa=item.payload.get('justificativa'),
+        )
+        if not sucesso:
+            if svc.falha_de_rede:
+                raise ConnectionError(mensagem)
+            raise Rejeitada(mensagem)
+        db.register_manifestacao(item.chave, tipo_evento, item.informante,
+                                 status='REGISTRADA', protocolo=protocolo)
+        logger.info(f"✅ [FILA] Manifestação {tipo_evento} de {item.chave} registrada: protocolo={protocolo}")
+
+    def buscar_chave(item):
+        from modules.busca_chaves_lote import BLOQUEADO, ERRO, OK, RESUMO
+        cert = _certificado(item.informante)
+        cnpj, path, senha, inf, cuf = cert
+        if not db.pode_consultar_certificado(inf, db.get_last_nsu(inf)):
+            raise Adiar(ESPERA_COOLDOWN_656, "cooldown erro 656")
+        if cnpj not in servicos:
+            servicos[cnpj] = NFeService(path, senha, cnpj, cuf)
+        resultado = buscar_documento_por_chave(servicos[cnpj], item.chave, cnpj)
+        if resultado.situacao == BLOQUEADO:
+            raise Adiar(ESPERA_COOLDOWN_656, "Consumo indevido (656)")
+        if resultado.situacao == ERRO:
+            raise ConnectionError(f"SEFAZ sem resposta para {item.chave}: {resultado.mensagem}")
+        if resultado.dados.get('cStat'):
+            db.set_nf_status(item.chave, resultado.dados['cStat'], resultado.dados.get('xMotivo', ''))
+        if resultado.situacao == RESUMO:
+            db.salvar_nota_detalhada(dict(resultado.dados['resumo'], informante=inf))
+            logger.info(f"📋 [FILA] {item.chave} autorizado, salvo como RESUMO")
+            return
+        if resultado.situacao != OK:
+            raise Rejeitada(f"Documento não disponível: {resultado.mensagem}")
+        salvar_documento_por_chave(db, item.chave, resultado.xml, cert, nsu=resultado.dados.get('nsu', ''))
+        logger.info(f"✅ [FILA] {item.chave} baixado e salvo como COMPLETO")
+
+    def consultar_status(item):
+        from modules.database import DatabaseManager as DatabaseInterface
+        certificados = [
+            {'cnpj_cpf': cnpj, 'caminho': path, 'senha': senha, 'informante': inf, 'cUF_autor': cuf}
+            for cnpj, path, senha, inf, cuf in db.get_certificados()
+        ]
+        stats = atualizar_status_notas_lote(DatabaseInterface(db.db_path), certificados,
+                                            [item.chave], max_workers=1)
+        if stats.get('erros'):
+            raise RuntimeError(f"Consulta de eventos de {item.chave} falhou")
+
+    return {
+        'manifestacao': manifestar,
+        'busca_chave': buscar_chave,
+        'status': consultar_status,
+    }
+
+
+def drenar_fila_offline(db) -> dict:
+    """
+    Refaz os pedidos feitos sem conexão (manifestação, busca por chave,
+    status), se a SEFAZ estiver acessível. Um reprodutor por banco no
+    processo: o limite por certificado vale entre chamadas.
+    """
+    chave = str(Path(db.db_path).resolve())
+    reprodutor = _reprodutores_fila.get(chave)
+    if reprodutor is None:
+        reprodutor = _reprodutores_fila[chave] = ReprodutorFila(db.db_path, {}, sonda=sonda_conectividade)
+    reprodutor.executores = executores_fila(db)
+    try:
+        return reprodutor.drenar()
+    except Exception as e:
+        logger.warning(f"⚠️ [FILA] Falha ao reprocessar a fila offline: {e}")
+        return {}
+
+
 def atualizar_status_notas_lote(db, certificados, chaves_list, progress_callback=None, max_workers=5):
     """
     Atualiza o status de múltiplas notas consultando eventos na SEFAZ (com paralelização).
@@ -6661,6 +6970,7 @@ def atualizar_status_notas_lote(db, certificados, chaves_list, progress_callback
     
     total_chaves = len(chaves_list)
     processadas = [0]  # Lista para ser mutável em closure
+    resultados_agenda = []  # (chave, resultado) para status_agenda
     processadas_lock = threading.Lock()
     
     def consultar_chave(chave, cert_data, cuf):
@@ -6695,6 +7005,16 @@ def atualizar_status_notas_lote(db, certificados, chaves_list, progress_callback
             # Consulta eventos da chave
             xml_resposta = svc.consultar_eventos_chave(chave)
             
+            if not xml_resposta and getattr(svc, 'falha_de_rede', False):
+                # Sem conexão: a consulta é refeita pela fila offline quando a SEFAZ voltar
+                try:
+                    db.enfileirar_requisicao('status', '', chave)
+                except Exception as e_fila:
+                    logger.debug(f"Não foi possível enfileirar status de {chave}: {e_fila}")
+                with stats_lock:
+                    stats['erros'] += 1
+                return 'erro'
+            
             with stats_lock:
                 stats['consultadas'] += 1
             
@@ -6803,6 +7123,7 @@ def atualizar_status_notas_lote(db, certificados, chaves_list, progress_callback
             logger.error(f"Erro ao criar serviço NFe para UF {cuf}: {e}")
             with stats_lock:
                 stats['erros'] += len(chaves)
+            resultados_agenda.extend((chave, 'erro') for chave in chaves)
             continue
 
         # Paraleliza consultas com ThreadPoolExecutor
@@ -6819,6 +7140,14 @@ def atualizar_status_notas_lote(db, certificados, chaves_list, progress_callback
                     resultado = future.result()
                 except Exception as e:
                     logger.error(f"Exceção não tratada ao consultar {chave}: {e}")
+                    resultado = 'erro'
+                resultados_agenda.append((chave, resultado))
+    
+    # Agenda a próxima verificação de cada chave (modules/agenda_status)
+    try:
+        db.registrar_verificacoes_status(resultados_agenda)
+    except Exception as e:
+        logger.warning(f"⚠️ Não foi possível registrar a agenda de verificação: {e}")
     
     logger.info(f"📊 Atualização concluída: {stats}")
     return stats
@@ -40,6 +40,7 @@ import sys
 import sqlite3
 import logging
 import re
+import time
 from pathlib import Path
 from datetime import datetime
 from lxml import etree
@@ -57,6 +58,8 @@ except ImportError:
     CRYPTO_AVAILABLE = False
     logging.warning("Módulo de criptografia não disponível")
 
+from modules.saude_endpoints import registro_compartilhado
+
 # -------------------------------------------------------------------
 # Consulta de CNPJ
 # -------------------------------------------------------------------
@@ -970,7 +973,14 @@ class NFSeService:
             # Tenta cada URL até obter sucesso
             logger.info(f"🔄 Testando {len(urls_tentar)} URL(s) - Tipo: {tipo_api}")
             
+            # Endpoints em falha recente (vistos por qualquer certificado) vão para o fim
+            saude = registro_compartilhado()
+            urls_tentar = saude.ordenar(urls_tentar)
+            
             for idx, url in enumerate(urls_tentar, 1):
+                if not saude.permite(url):
+                    logger.warning(f"⛔ [{idx}/{len(urls_tentar)}] Pulando {url} - indisponível (falhas recentes)")
+                    continue
                 logger.info(f"🌐 [{idx}/{len(urls_tentar)}] Tentando: {url}")
                 
                 # ADN REST não possui endpoint de consulta - apenas SOAP municipal disponível
@@ -987,18 +997,27 @@ class NFSeService:
                     # municipais com cadeia de certificado mal configurada.
                     verificar_servidor = determinar_verify_para_host(url, self.certificado_path, self.senha)
 
-                    response = requests_pkcs12.post(
-                        url,
-                        data=xml_consulta.encode('utf-8'),
-                        headers={
-                            'Content-Type': 'text/xml; charset=utf-8',
-                            'SOAPAction': ''  # Vazio, igual Fiscal.io
-                        },
-                        pkcs12_filename=self.certificado_path,
-                        pkcs12_password=self.senha,
-                        verify=verificar_servidor,
-                        timeout=15
-                    )
+                    inicio = time.monotonic()
+                    try:
+                        response = requests_pkcs12.post(
+                            url,
+                            data=xml_consulta.encode('utf-8'),
+                            headers={
+                                'Content-Type': 'text/xml; charset=utf-8',
+                                'SOAPAction': ''  # Vazio, igual Fiscal.io
+                            },
+                            pkcs12_filename=self.certificado_path,
+                            pkcs12_password=self.senha,
+                            verify=verificar_servidor,
+                            timeout=15
+                        )
+                    except requests.exceptions.RequestException as e:
+                        saude.registrar_falha(url, e)
+                        raise
+                    if response.status_code >= 500:
+                        saude.registrar_falha(url, f"HTTP {response.status_code}")
+                    else:
+                        saude.registrar_sucesso(url, time.monotonic() - inicio)
                     
                     logger.info(f"📥 Resposta recebida: HTTP {response.status_code}")
                     
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Arquivar meses — empacota os meses fechados de xmls/{CNPJ}/{ANO-MES}/ em um ZIP
+por CNPJ-mês (modules/arquivo_mensal) e reaponta o índice do notas.db para
+dentro do container. Também desfaz o arquivamento de um mês.
+
+Por padrão roda em modo DRY-RUN (apenas lista os meses elegíveis).
+Use --apply para arquivar. Em modo --apply, um backup timestampado do
+notas.db é criado automaticamente antes de qualquer escrita.
+
+Uso:
+    python scripts/arquivar_meses.py                          # lista meses fechados (dry-run)
+    python scripts/arquivar_meses.py --apply                  # arquiva meses fechados
+    python scripts/arquivar_meses.py --apply --meses-abertos 6
+    python scripts/arquivar_meses.py --desarquivar xmls/47539664000197/2025-01.zip
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import shutil
+import sys
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__" and sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.arquivo_mensal import arquivar_mes, desarquivar_mes, listar_meses_fechados
+
+
+def get_data_dir() -> Path:
+    try:
+        from nfe_search import get_data_dir as _gdd
+        return Path(_gdd())
+    except Exception:
+        return BASE_DIR
+
+
+def _backup(db_path: Path):
+    backup_path = db_path.with_name(f"notas.db.bak-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    shutil.copy2(db_path, backup_path)
+    print(f"💾 Backup criado: {backup_path}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--apply", action="store_true", help="Arquiva de fato (sem isso, roda em dry-run)")
+    ap.add_argument("--meses-abertos", type=int, default=2,
+                    help="Quantos meses recentes (incluindo o atual) permanecem soltos (padrão: 2)")
+    ap.add_argument("--desarquivar", metavar="ZIP", help="Extrai um {ANO-MES}.zip de volta para arquivos soltos")
+    args = ap.parse_args()
+
+    data_dir = get_data_dir()
+    db_path = data_dir / "notas.db"
+
+    if args.desarquivar:
+        _backup(db_path)
+        resultado = desarquivar_mes(Path(args.desarquivar), db_path)
+        print(f"✅ {resultado['arquivos']} XML(s) restaurados de {args.desarquivar}")
+        return
+
+    meses = listar_meses_fechados(data_dir / "xmls", meses_abertos=args.meses_abertos)
+
+    print("=" * 78)
+    print(f"ARQUIVAR MESES — {'APLICANDO MUDANÇAS' if args.apply else 'DRY-RUN (nenhuma escrita)'}")
+    print(f"Banco: {db_path}")
+    print(f"Meses fechados encontrados: {len(meses)}")
+    print("=" * 78)
+
+    if not args.apply:
+        for pasta in meses:
+            qtd = sum(1 for _ in pasta.rglob("*.xml"))
+            print(f"  {pasta.parent.name}/{pasta.name}: {qtd} XML(s)")
+        print("\n⚠️  DRY-RUN — nada foi gravado. Rode novamente com --apply para arquivar.")
+        return
+
+    _backup(db_path)
+    total_arquivos = total_soltos = total_zip = 0
+    for pasta in meses:
+        resultado = arquivar_mes(pasta, db_path)
+        if not resultado["arquivos"]:
+            continue
+        total_arquivos += resultado["arquivos"]
+        total_soltos += resultado["bytes_soltos"]
+        total_zip += resultado["bytes_zip"]
+        print(f"📦 {pasta.parent.name}/{pasta.name}.zip: {resultado['arquivos']} XML(s)")
+
+    print(f"\n✅ {total_arquivos} XML(s) arquivados — "
+          f"{total_soltos / 1048576:.1f} MB soltos → {total_zip / 1048576:.1f} MB em ZIP")
+
+
+if __name__ == "__main__":
+    main()
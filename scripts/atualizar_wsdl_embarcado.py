@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Atualizar WSDL embarcado — baixa os WSDLs (e XSDs importados) da Distribuição
+DFe, Consulta Protocolo e CT-e com um certificado A1 e grava em
+Arquivo_wsdl/ com manifesto versionado (url → arquivo + sha256), que o
+BOT_Busca_NFE.spec embarca no executável (modules/wsdl_cache).
+
+Rodar antes de cada release — a SEFAZ exige certificado cliente até para o
+?wsdl, por isso os documentos não são baixados no build.
+
+Uso:
+    python scripts/atualizar_wsdl_embarcado.py --pfx certificado.pfx --senha 1234
+    python scripts/atualizar_wsdl_embarcado.py --pfx certificado.pfx --senha 1234 --versao 2026.10
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__" and sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.wsdl_cache import PASTA_EMBARCADA, CacheDocumentos
+
+
+def urls_embarcadas() -> list:
+    from nfe_search import CONSULTA_WSDL, URL_CONSULTA_FALLBACK, URL_DISTRIBUICAO
+    from modules.cte_service import URL_CTE_DISTRIBUICAO_PROD
+    urls = [URL_DISTRIBUICAO, URL_CONSULTA_FALLBACK, *CONSULTA_WSDL.values(), URL_CTE_DISTRIBUICAO_PROD]
+    return list(dict.fromkeys(u for u in urls if u))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pfx", required=True, help="Certificado A1 (.pfx) usado no download")
+    ap.add_argument("--senha", required=True)
+    ap.add_argument("--versao", default=datetime.now().strftime("%Y.%m.%d"))
+    ap.add_argument("--destino", default=str(BASE_DIR / PASTA_EMBARCADA))
+    args = ap.parse_args()
+
+    import requests
+    import requests_pkcs12
+    from zeep import Client
+    from zeep.settings import Settings
+    from zeep.transports import Transport
+
+    sess = requests.Session()
+    sess.mount('https://', requests_pkcs12.Pkcs12Adapter(pkcs12_filename=args.pfx, pkcs12_password=args.senha))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheDocumentos(Path(tmp) / "wsdl.db")
+        transport = Transport(session=sess, timeout=60, cache=cache)
+        falhas = 0
+        for url in urls_embarcadas():
+            try:
+                Client(wsdl=url, transport=transport,
+                       settings=Settings(strict=False, xml_huge_tree=True, xsd_ignore_sequence_order=True))
+                print(f"✅ {url}")
+            except Exception as e:
+                falhas += 1
+                print(f"❌ {url}: {e}")
+        total = cache.exportar(Path(args.destino), args.versao)
+
+    print(f"\n📦 {total} documento(s) gravado(s) em {args.destino} (versão {args.versao})")
+    if falhas:
+        print(f"⚠️ {falhas} WSDL(s) não baixado(s) — serão buscados em tempo de execução")
+    return 1 if falhas and not total else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Compactar payloads — migração única das colunas xmls_baixados.xml_completo e
+historico_nsu.detalhes_json de TEXT para BLOB compactado (modules/payload_codec),
+com relatório de tamanho antes/depois.
+
+Por padrão roda em modo DRY-RUN (apenas relatório de ocupação atual).
+Use --apply para converter. Em modo --apply, um backup timestampado do
+notas.db é criado automaticamente antes de qualquer escrita.
+
+Uso:
+    python scripts/compactar_payloads.py                   # relatório (dry-run)
+    python scripts/compactar_payloads.py --apply           # converte TEXT -> BLOB
+    python scripts/compactar_payloads.py --apply --vacuum  # converte e devolve espaço ao disco
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import shutil
+import sys
+from datetime import datetime
+from pathlib import Path
+
+if __name__ == "__main__" and sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.payload_codec import migrar_payloads, relatorio_tamanho
+
+
+def get_data_dir() -> Path:
+    try:
+        from nfe_search import get_data_dir as _gdd
+        return Path(_gdd())
+    except Exception:
+        return BASE_DIR
+
+
+def _mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+
+def imprimir_relatorio(titulo: str, relatorio: dict):
+    print(f"\n{titulo}")
+    print("-" * 78)
+    for coluna, stats in relatorio.items():
+        if coluna == "arquivo":
+            continue
+        print(f"{coluna:32s} TEXT: {stats['linhas_texto']:>8} linhas / {_mb(stats['bytes_texto']):>10}   "
+              f"BLOB: {stats['linhas_blob']:>8} linhas / {_mb(stats['bytes_blob']):>10}")
+    print(f"{'notas.db (arquivo)':32s} {_mb(relatorio['arquivo']['bytes'])}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--apply", action="store_true", help="Converte os payloads (sem isso, apenas relatório)")
+    ap.add_argument("--vacuum", action="store_true", help="Executa VACUUM ao final para devolver espaço ao disco")
+    ap.add_argument("--db", help="Caminho do notas.db (padrão: pasta de dados do app)")
+    args = ap.parse_args()
+
+    db_path = Path(args.db) if args.db else get_data_dir() / "notas.db"
+
+    print("=" * 78)
+    print(f"COMPACTAR PAYLOADS — {'APLICANDO MUDANÇAS' if args.apply else 'DRY-RUN (nenhuma escrita)'}")
+    print(f"Banco: {db_path}")
+    print("=" * 78)
+
+    imprimir_relatorio("ANTES", relatorio_tamanho(db_path))
+
+    if not args.apply:
+        print("\n⚠️  DRY-RUN — nada foi gravado. Rode novamente com --apply para compactar.")
+        return
+
+    backup_path = db_path.with_name(f"notas.db.bak-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    shutil.copy2(db_path, backup_path)
+    print(f"\n💾 Backup criado: {backup_path}")
+
+    resultado = migrar_payloads(db_path, vacuum=args.vacuum)
+    for chave, valor in resultado.items():
+        if "." in chave:
+            print(f"✅ {chave}: {valor} linhas compactadas")
+    if resultado["bytes_antes"]:
+        razao = resultado["bytes_antes"] / max(resultado["bytes_depois"], 1)
+        print(f"📦 Payload: {_mb(resultado['bytes_antes'])} -> {_mb(resultado['bytes_depois'])} ({razao:.1f}x menor)")
+
+    imprimir_relatorio("DEPOIS", relatorio_tamanho(db_path))
+    if not args.vacuum:
+        print("\nℹ️  Rode com --vacuum (com o app fechado) para o arquivo notas.db encolher no disco.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/agenda_status.py: intervalo de verificação pela idade da
+nota, estados finais (prazo de eventos, cancelamento) e lote de chaves devidas.
+
+Uso:
+    python -m unittest tests.unit.test_agenda_status -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.agenda_status import (
+    DIA, ESPERA_APOS_ERRO, HORA, INTERVALO_MINIMO, PRAZO_EVENTOS,
+    chaves_devidas, criar_tabela, proxima_verificacao, registrar_verificacoes,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+AGORA = 1_790_000_000
+
+
+def _chave(modelo: str, n: int) -> str:
+    return f"35261047539664000197{modelo}001{n:09d}1{n:08d}".ljust(44, "0")[:44]
+
+
+class TestAgendaStatus(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmpdir.name) / "notas.db"
+        aplicar_migracoes(self.db_path)
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _inserir(self, conn, chave, idade_dias, status="Autorizado o uso da NF-e", xml_status="COMPLETO"):
+        conn.execute("INSERT INTO notas_detalhadas (chave, status, xml_status) VALUES (?, ?, ?)",
+                     (chave, status, xml_status))
+        # data_emissao_epoch é preenchida por gatilho; aqui o teste fixa a idade
+        conn.execute("UPDATE notas_detalhadas SET data_emissao_epoch = ? WHERE chave = ?",
+                     (AGORA - int(idade_dias * DIA), chave))
+
+    def test_intervalo_cresce_com_idade_e_respeita_prazo(self):
+        chave = _chave("55", 1)
+        recente = proxima_verificacao(chave, AGORA - HORA, AGORA) - AGORA
+        antiga = proxima_verificacao(chave, AGORA - 20 * DIA, AGORA) - AGORA
+        self.assertEqual(recente, INTERVALO_MINIMO)
+        self.assertEqual(antiga, 5 * DIA)
+        # Nunca passa do fim do prazo; depois dele a chave é final
+        self.assertEqual(proxima_verificacao(chave, AGORA - 29 * DIA, AGORA), AGORA + DIA)
+        self.assertIsNone(proxima_verificacao(chave, AGORA - 31 * DIA, AGORA))
+        self.assertIsNone(proxima_verificacao(_chave("65", 2), AGORA - 3 * DIA, AGORA))
+        self.assertEqual(PRAZO_EVENTOS["57"], 45 * DIA)
+
+    def test_devidas_ordem_exclusoes_e_registro(self):
+        nunca, vencida, futura, evento, cancelada, velha = (_chave("55", i) for i in range(1, 7))
+        with sqlite3.connect(str(self.db_path)) as conn:
+            self._inserir(conn, nunca, 1)
+            self._inserir(conn, vencida, 10)
+            self._inserir(conn, futura, 10)
+            self._inserir(conn, evento, 1, xml_status="EVENTO")
+            self._inserir(conn, cancelada, 1, status="Cancelamento de NF-e homologado")
+            self._inserir(conn, velha, 90)
+            # Migração em banco existente: nota fora do prazo já entra como final
+            criar_tabela(conn, agora=AGORA)
+            conn.execute("INSERT INTO status_agenda (chave, last_checked, next_check) VALUES (?, ?, ?)",
+                         (vencida, AGORA - DIA, AGORA - HORA))
+            conn.execute("INSERT INTO status_agenda (chave, last_checked, next_check) VALUES (?, ?, ?)",
+                         (futura, AGORA - HORA, AGORA + DIA))
+
+            self.assertEqual(chaves_devidas(conn, agora=AGORA), [nunca, vencida])
+            self.assertEqual(chaves_devidas(conn, agora=AGORA, modelos=("57",)), [])
+
+            registrar_verificacoes(conn, [(nunca, None), (vencida, "cancelada")], agora=AGORA)
+            # Nota de 1 dia: próxima verificação em 1/4 da idade (6 h)
+            self.assertEqual(chaves_devidas(conn, agora=AGORA + HORA), [])
+            self.assertEqual(chaves_devidas(conn, agora=AGORA + 6 * HORA), [nunca])
+            self.assertEqual(conn.execute("SELECT final FROM status_agenda WHERE chave = ?",
+                                          (vencida,)).fetchone(), (1,))
+
+            # Erro: nova tentativa em 1 h, sem contar como verificação
+            registrar_verificacoes(conn, [(nunca, "erro")], agora=AGORA + HORA)
+            linha = conn.execute("SELECT last_checked, next_check, verificacoes FROM status_agenda "
+                                 "WHERE chave = ?", (nunca,)).fetchone()
+            self.assertEqual(linha, (AGORA, AGORA + HORA + ESPERA_APOS_ERRO, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/arquivo_mensal.py: empacotamento de meses fechados em ZIP,
+leitura aleatória pelo índice do banco, XML mais novo substituindo o membro
+arquivado, leitura concorrente com o cache de ZIPs cheio e desarquivamento.
+
+Uso:
+    python -m unittest tests.unit.test_arquivo_mensal -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from datetime import date
+from pathlib import Path
+from unittest import mock
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules import arquivo_mensal
+from modules.arquivo_mensal import (
+    arquivar_mes, caminho_existe, caminho_solto, desarquivar_mes,
+    is_caminho_arquivado, ler_bytes, ler_xml, listar_meses_fechados, montar_caminho,
+)
+
+CNPJ = "47539664000197"
+
+
+class TestArquivoMensal(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        base = Path(self._tmpdir.name)
+        self.xmls = base / "xmls"
+        self.db_path = base / "notas.db"
+        self.pasta_mes = self.xmls / CNPJ / "2025-01"
+        (self.pasta_mes / "NFe").mkdir(parents=True)
+        (self.pasta_mes / "Eventos").mkdir(parents=True)
+        (self.xmls / CNPJ / "2026-10" / "NFe").mkdir(parents=True)
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.executescript("""
+            CREATE TABLE xmls_baixados (chave TEXT PRIMARY KEY, caminho_arquivo TEXT);
+            CREATE TABLE xmls_caminhos (id INTEGER PRIMARY KEY, chave TEXT, caminho TEXT,
+                                        UNIQUE(chave, caminho));
+        """)
+        self.chaves = [f"{i:044d}" for i in range(1, 6)]
+        for chave in self.chaves:
+            arq = self.pasta_mes / "NFe" / f"{chave}.xml"
+            arq.write_text(f"<nfeProc><chNFe>{chave}</chNFe></nfeProc>", encoding="utf-8")
+            conn.execute("INSERT INTO xmls_baixados VALUES (?, ?)", (chave, str(arq)))
+            conn.execute("INSERT INTO xmls_caminhos (chave, caminho) VALUES (?, ?)", (chave, str(arq)))
+        (self.pasta_mes / "NFe" / f"{self.chaves[0]}.pdf").write_bytes(b"%PDF-1.4")
+        (self.pasta_mes / "Eventos" / "evento.xml").write_text("<evento/>", encoding="utf-8")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _caminho_no_banco(self, chave):
+        with sqlite3.connect(str(self.db_path)) as conn:
+            return conn.execute("SELECT caminho_arquivo FROM xmls_baixados WHERE chave = ?",
+                                (chave,)).fetchone()[0]
+
+    def test_lista_apenas_meses_fechados(self):
+        meses = listar_meses_fechados(self.xmls, meses_abertos=2, hoje=date(2026, 10, 19))
+        self.assertEqual([p.name for p in meses], ["2025-01"])
+
+    def test_arquivar_reaponta_indice_e_le_do_zip(self):
+        resultado = arquivar_mes(self.pasta_mes, self.db_path)
+        self.assertEqual(resultado["arquivos"], 6)
+        self.assertTrue((self.xmls / CNPJ / "2025-01.zip").exists())
+        self.assertFalse((self.pasta_mes / "NFe" / f"{self.chaves[1]}.xml").exists())
+        # PDF continua solto na pasta do mês
+        self.assertTrue((self.pasta_mes / "NFe" / f"{self.chaves[0]}.pdf").exists())
+
+        for chave in self.chaves:
+            caminho = self._caminho_no_banco(chave)
+            self.assertTrue(is_caminho_arquivado(caminho))
+            self.assertTrue(caminho_existe(caminho))
+            self.assertIn(chave, ler_xml(caminho))
+        self.assertEqual(caminho_solto(self._caminho_no_banco(self.chaves[0])).with_suffix(".pdf"),
+                         self.pasta_mes / "NFe" / f"{self.chaves[0]}.pdf")
+
+    def test_xml_atrasado_e_acrescentado(self):
+        arquivar_mes(self.pasta_mes, self.db_path)
+        (self.pasta_mes / "NFe").mkdir(parents=True, exist_ok=True)
+        atrasado = self.pasta_mes / "NFe" / ("9" * 44 + ".xml")
+        atrasado.write_text("<nfeProc>atrasado</nfeProc>", encoding="utf-8")
+        arquivar_mes(self.pasta_mes, self.db_path)
+        self.assertIn(self.chaves[0], ler_xml(self._caminho_no_banco(self.chaves[0])))
+        self.assertFalse(atrasado.exists())
+
+    def test_xml_mais_novo_substitui_membro_arquivado(self):
+        arquivar_mes(self.pasta_mes, self.db_path)
+        (self.pasta_mes / "NFe").mkdir(parents=True, exist_ok=True)
+        completo = self.pasta_mes / "NFe" / f"{self.chaves[0]}.xml"   # resumo arquivado, agora completo
+        completo.write_text("<nfeProc>completo</nfeProc>", encoding="utf-8")
+        arquivar_mes(self.pasta_mes, self.db_path)
+
+        self.assertFalse(completo.exists())
+        self.assertEqual(ler_xml(self._caminho_no_banco(self.chaves[0])), "<nfeProc>completo</nfeProc>")
+        self.assertIn(self.chaves[1], ler_xml(self._caminho_no_banco(self.chaves[1])))
+        with zipfile.ZipFile(self.xmls / CNPJ / "2025-01.zip") as zf:
+            nomes = zf.namelist()
+        self.assertEqual(len(nomes), len(set(nomes)), nomes)   # sem membro duplicado
+        self.assertEqual(len(nomes), 6)
+
+    def test_desarquivar_restaura_arquivos_soltos(self):
+        arquivar_mes(self.pasta_mes, self.db_path)
+        zip_path = self.xmls / CNPJ / "2025-01.zip"
+        resultado = desarquivar_mes(zip_path, self.db_path)
+        self.assertEqual(resultado["arquivos"], 6)
+        self.assertFalse(zip_path.exists())
+        for chave in self.chaves:
+            caminho = self._caminho_no_banco(chave)
+            self.assertFalse(is_caminho_arquivado(caminho))
+            self.assertTrue(Path(caminho).exists())
+            self.assertIn(chave, ler_xml(caminho))
+
+    def test_leitura_concorrente_com_cache_cheio(self):
+        # cache de 1 ZIP: cada leitura de outro mês fecha o ZipFile que a
+        # thread vizinha acabou de pegar do cache
+        caminhos = []
+        for mes in ("2024-01", "2024-02", "2024-03"):
+            zip_path = self.xmls / CNPJ / f"{mes}.zip"
+            with zipfile.ZipFile(zip_path, "w") as zf:
+                zf.writestr("NFe/x.xml", f"<mes>{mes}</mes>")
+            caminhos.append(montar_caminho(zip_path, "NFe/x.xml"))
+        erros = []
+
+        def ler(deslocamento):
+            try:
+                for i in range(300):
+                    caminho = caminhos[(i + deslocamento) % len(caminhos)]
+                    if not caminho_existe(caminho) or ler_bytes(caminho) is None:
+                        erros.append(caminho)
+            except Exception as e:
+                erros.append(e)
+
+        with mock.patch.object(arquivo_mensal, "_MAX_ZIPS_ABERTOS", 1):
+            threads = [threading.Thread(target=ler, args=(n,)) for n in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        for mes in ("2024-01", "2024-02", "2024-03"):
+            arquivo_mensal._fechar_zip(str(self.xmls / CNPJ / f"{mes}.zip"))
+        self.assertEqual(erros, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
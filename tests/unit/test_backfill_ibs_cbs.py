@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/backfill_ibs_cbs.py: precedência da extração por
+iterparse, localização (banco, arquivo mensal, varredura de pasta),
+gravação em lote, checkpoint/retomada e pool de processos.
+
+Uso:
+    python -m unittest tests.unit.test_backfill_ibs_cbs -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.arquivo_mensal import montar_caminho
+from modules.backfill_ibs_cbs import (
+    CHAVE_CHECKPOINT, BackfillIBSCBS, contar_pendentes, extrair_ibs_cbs, ler_checkpoint,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+NS = 'xmlns="http://www.portalfiscal.inf.br/nfe"'
+
+
+def nfe(ibs_tot="", icms_tot="", item=""):
+    return (f'<nfeProc {NS}><NFe><infNFe><det nItem="1"><imposto><IBSCBS><gIBSCBS>{item}'
+            f'</gIBSCBS></IBSCBS></imposto></det><total><ICMSTot><vNF>100.00</vNF>{icms_tot}</ICMSTot>'
+            f'{ibs_tot}</total></infNFe></NFe><protNFe/></nfeProc>').encode()
+
+
+TOTAL = "<IBSCBSTot><gIBS><vIBS>10.00</vIBS></gIBS><gCBS><vCBS>90.00</vCBS></gCBS></IBSCBSTot>"
+
+
+class TestExtracao(unittest.TestCase):
+    def test_precedencia(self):
+        item = "<vIBS>1.00</vIBS><gCBS><vCBS>2.00</vCBS></gCBS>"
+        self.assertEqual(extrair_ibs_cbs(nfe(TOTAL, item=item)), ("10.00", "90.00"))
+        self.assertEqual(extrair_ibs_cbs(nfe(icms_tot="<vIBS>3.00</vIBS>", item=item)), ("3.00", "2.00"))
+        self.assertEqual(extrair_ibs_cbs(nfe()), ("", ""))
+
+    def test_para_no_fim_do_grupo(self):
+        # Lixo depois de IBSCBSTot não é lido
+        dados = nfe(TOTAL).replace(b"<protNFe/></nfeProc>", b"<protNFe><<<")
+        self.assertEqual(extrair_ibs_cbs(dados), ("10.00", "90.00"))
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        self.db_path = self.dir / "notas.db"
+        aplicar_migracoes(self.db_path)
+        self.xmls = self.dir / "xmls"
+        (self.xmls / "2025-01").mkdir(parents=True)
+
+        self.chaves = [f"{i}" * 44 for i in range(1, 7)]
+        solto = self.xmls / "2025-01" / f"{self.chaves[0]}.xml"
+        solto.write_bytes(nfe(TOTAL))
+        with zipfile.ZipFile(self.xmls / "2025-02.zip", 'w') as zf:
+            zf.writestr(f"NFe/{self.chaves[1]}.xml", nfe(icms_tot="<vIBS>5.5</vIBS><vCBS>4.5</vCBS>"))
+        (self.xmls / "2025-01" / f"{self.chaves[2]}.xml").write_bytes(nfe(TOTAL))   # só na pasta
+        (self.xmls / "2025-01" / f"{self.chaves[3]}.xml").write_bytes(nfe())        # pré-Reforma
+        (self.xmls / "2025-01" / f"{self.chaves[4]}.xml").write_bytes(b"<nfeProc>")  # corrompido
+        # chaves[5]: sem XML em lugar nenhum
+
+        with sqlite3.connect(self.db_path) as conn:
+            for chave in self.chaves:
+                conn.execute("INSERT INTO notas_detalhadas (chave, tipo, numero, v_ibs, v_cbs) "
+                             "VALUES (?, 'NFe', '1', '', '')", (chave,))
+            conn.execute("INSERT INTO notas_detalhadas (chave, tipo, numero) VALUES (?, 'CTe', '1')", ("9" * 44,))
+            conn.execute("INSERT INTO xmls_caminhos (chave, caminho) VALUES (?, ?)", (self.chaves[0], str(solto)))
+            conn.execute("INSERT INTO xmls_baixados (chave, caminho_arquivo) VALUES (?, ?)",
+                         (self.chaves[1], montar_caminho(self.xmls / "2025-02.zip", f"NFe/{self.chaves[1]}.xml")))
+            conn.execute("INSERT INTO xmls_baixados (chave, caminho_arquivo) VALUES (?, ?)",
+                         (self.chaves[3], str(self.dir / "movido.xml")))
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _valores(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return {c: (i, b) for c, i, b in conn.execute(
+                "SELECT chave, v_ibs_centavos, v_cbs_centavos FROM notas_detalhadas WHERE tipo = 'NFe'")}
+
+    def _job(self, **kwargs):
+        return BackfillIBSCBS(self.db_path, pasta_xmls=self.xmls, processos=1, **kwargs)
+
+    def test_preenche_e_classifica(self):
+        stats = self._job().executar()
+
+        self.assertEqual((stats['total'], stats['processadas'], stats['atualizadas'], stats['sem_valores'],
+                          stats['nao_encontradas'], stats['erros']), (6, 6, 3, 1, 1, 1))
+        valores = self._valores()
+        self.assertEqual(valores[self.chaves[0]], (1000, 9000))
+        self.assertEqual(valores[self.chaves[1]], (550, 450))
+        self.assertEqual(valores[self.chaves[2]], (1000, 9000))
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(contar_pendentes(conn), 3)
+            self.assertEqual(ler_checkpoint(conn), 0)
+
+    def test_checkpoint_e_retomada(self):
+        job = self._job(lote=2)
+        stats = job.executar(progresso=lambda feitos, total, s: job.cancelar())
+
+        self.assertTrue(stats['cancelado'])
+        self.assertEqual(stats['processadas'], 2)
+        with sqlite3.connect(self.db_path) as conn:
+            checkpoint = ler_checkpoint(conn)
+            self.assertGreater(checkpoint, 0)
+            self.assertEqual(contar_pendentes(conn, checkpoint), 4)
+
+        stats = self._job(lote=2).executar()
+        self.assertEqual((stats['total'], stats['processadas'], stats['atualizadas']), (4, 4, 1))
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertIsNone(conn.execute("SELECT valor FROM config WHERE chave = ?",
+                                           (CHAVE_CHECKPOINT,)).fetchone())
+
+        # Recomeçar ignora o checkpoint: as três sem valor voltam a ser verificadas
+        self.assertEqual(self._job(recomecar=True).executar()['total'], 3)
+
+    def test_pool_de_processos(self):
+        with mock.patch.object(BackfillIBSCBS, 'MINIMO_POOL', 0), \
+                mock.patch.object(BackfillIBSCBS, 'LOTE_PROCESSO', 2):
+            stats = BackfillIBSCBS(self.db_path, pasta_xmls=self.xmls, processos=2).executar()
+
+        self.assertEqual((stats['atualizadas'], stats['sem_valores'], stats['nao_encontradas']), (3, 1, 1))
+        self.assertEqual(self._valores()[self.chaves[1]], (550, 450))
+
+
+if __name__ == "__main__":
+    unittest.main()
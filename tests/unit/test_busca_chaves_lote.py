@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/busca_chaves_lote.py: normalização, roteamento por
+certificado, encaminhamento entre certificados (outro certificado / 656),
+chaves já baixadas, lista de retentativa e cancelamento.
+
+Uso:
+    python -m unittest tests.unit.test_busca_chaves_lote -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.busca_chaves_lote import (
+    BLOQUEADO, CANCELADA, ERRO, JA_BAIXADA, NAO_ENCONTRADA, OK, OUTRO_CERTIFICADO,
+    BuscaChavesLote, ResultadoChave, donos_conhecidos, ja_baixadas, normalizar_chaves, rotear,
+)
+
+EMIT = "12345678000199"
+CERT_SP = ("11111111000111", "a.pfx", "x", "11111111000111", "35")
+CERT_EMIT = (EMIT, "b.pfx", "x", EMIT, "41")
+CERT_MG = ("22222222000122", "c.pfx", "x", "22222222000122", "31")
+CHAVE_A = f"352401{EMIT}550010000000011000000011"
+CHAVE_B = f"352401{EMIT}550010000000021000000021"
+CHAVE_C = "31240199999999000199550010000000031000000031"
+
+
+def _motor(certificados, buscar, **kwargs):
+    kwargs.setdefault('intervalo_minimo', 0)
+    return BuscaChavesLote(certificados, buscar, **kwargs)
+
+
+class TestBuscaChavesLote(unittest.TestCase):
+    def test_normalizar_e_rotear(self):
+        self.assertEqual(normalizar_chaves([f" {CHAVE_A[:10]}.{CHAVE_A[10:]} ", CHAVE_A, "123", CHAVE_B]),
+                         [CHAVE_A, CHAVE_B])
+        certs = [CERT_MG, CERT_SP, CERT_EMIT]
+        self.assertEqual(rotear(CHAVE_A, certs), [2, 1, 0])          # emitente, UF 35, demais
+        self.assertEqual(rotear(CHAVE_A, certs, dono="22.222.222/0001-22"), [0, 2, 1])
+
+    def test_banco_ja_baixadas_e_donos(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE notas_detalhadas (chave TEXT, informante TEXT, xml_status TEXT)")
+        conn.executemany("INSERT INTO notas_detalhadas VALUES (?, ?, ?)", [
+            (CHAVE_A, EMIT, 'COMPLETO'), (CHAVE_B, CERT_MG[0], 'RESUMO')])
+        self.assertEqual(ja_baixadas(conn, [CHAVE_A, CHAVE_B, CHAVE_C]), {CHAVE_A})
+        self.assertEqual(donos_conhecidos(conn, [CHAVE_B, CHAVE_C]), {CHAVE_B: CERT_MG[0]})
+
+    def test_encaminha_entre_certificados_e_bloqueia_656(self):
+        certs = [CERT_SP, CERT_EMIT, CERT_MG]
+        chamadas = []
+        lock = threading.Lock()
+
+        def buscar(chave, indice):
+            with lock:
+                chamadas.append((chave, indice))
+            if indice == 1:
+                return ResultadoChave(chave, BLOQUEADO)
+            if indice == 0 and chave == CHAVE_A:
+                return ResultadoChave(chave, OK, xml="<nfeProc/>")
+            return ResultadoChave(chave, OUTRO_CERTIFICADO)
+
+        motor = _motor(certs, buscar)
+        resultados = {r.chave: r for r in motor.executar([CHAVE_A, CHAVE_B, CHAVE_C], ja_baixadas=[CHAVE_C])}
+
+        self.assertEqual(resultados[CHAVE_C].situacao, JA_BAIXADA)
+        self.assertEqual((resultados[CHAVE_A].situacao, resultados[CHAVE_A].certificado), (OK, 0))
+        self.assertEqual(resultados[CHAVE_B].situacao, BLOQUEADO)
+        self.assertEqual(resultados[CHAVE_B].certificado, 1)
+        # O emitente (656) foi consultado uma única vez; a outra chave nem chegou a ele
+        self.assertEqual(sum(1 for _, i in chamadas if i == 1), 1)
+        self.assertNotIn((CHAVE_C, 0), chamadas)
+        self.assertEqual(motor.bloqueados, {1})
+        self.assertEqual(motor.lista_retentativa(), [CHAVE_B])
+
+    def test_erro_e_nao_encontrada(self):
+        def buscar(chave, indice):
+            if chave == CHAVE_A:
+                raise ConnectionError("reset")
+            return ResultadoChave(chave, OUTRO_CERTIFICADO)
+
+        motor = _motor([CERT_SP, CERT_MG], buscar)
+        resultados = {r.chave: r for r in motor.executar([CHAVE_A, CHAVE_B])}
+        self.assertEqual(resultados[CHAVE_A].situacao, ERRO)
+        self.assertIn("reset", resultados[CHAVE_A].mensagem)
+        self.assertEqual(resultados[CHAVE_B].situacao, NAO_ENCONTRADA)
+        self.assertEqual(motor.lista_retentativa([ERRO]), [CHAVE_A])
+
+    def test_cancelamento(self):
+        motor = None
+
+        def buscar(chave, indice):
+            motor.cancelar()
+            return ResultadoChave(chave, OK)
+
+        motor = _motor([CERT_SP], buscar)
+        situacoes = sorted(r.situacao for r in motor.executar([CHAVE_A, CHAVE_B, CHAVE_C]))
+        self.assertEqual(situacoes, [CANCELADA, CANCELADA, OK])
+        self.assertEqual(motor.requisicoes, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
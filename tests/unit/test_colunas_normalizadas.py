@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/colunas_normalizadas.py: colunas em centavos e data ISO de
+notas_detalhadas preenchidas por gatilho e no backfill da migração.
+
+Uso:
+    python -m unittest tests.unit.test_colunas_normalizadas -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.colunas_normalizadas import formatar_centavos, iso_para_br
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+
+class TestColunasNormalizadas(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmpdir.name) / "notas.db"
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _inserir(self, conn, chave, valor, data, v_ibs=None):
+        conn.execute("INSERT OR REPLACE INTO notas_detalhadas (chave, valor, data_emissao, v_ibs) "
+                     "VALUES (?, ?, ?, ?)", (chave, valor, data, v_ibs))
+
+    def _linha(self, conn, chave):
+        return conn.execute("SELECT valor_centavos, v_ibs_centavos, data_emissao_iso, data_emissao_epoch "
+                            "FROM notas_detalhadas WHERE chave = ?", (chave,)).fetchone()
+
+    def test_formatos_na_insercao(self):
+        aplicar_migracoes(self.db_path)
+        with sqlite3.connect(str(self.db_path)) as conn:
+            self._inserir(conn, "us", "1234.56", "2026-01-05T10:00:00-03:00", "0.00")
+            self._inserir(conn, "br", "R$ 1.234.567,89", "05/01/2026")
+            self._inserir(conn, "milhar", "1.234", "2026-01-05")
+            self._inserir(conn, "vazio", "", "")
+            self.assertEqual(self._linha(conn, "us"), (123456, 0, "2026-01-05", 1767618000))
+            self.assertEqual(self._linha(conn, "br")[:3], (123456789, None, "2026-01-05"))
+            self.assertEqual(self._linha(conn, "milhar")[0], 123400)
+            self.assertEqual(self._linha(conn, "vazio"), (0, None, None, None))
+
+    def test_update_recalcula(self):
+        aplicar_migracoes(self.db_path)
+        with sqlite3.connect(str(self.db_path)) as conn:
+            self._inserir(conn, "x", "10.00", "2026-01-05")
+            conn.execute("UPDATE notas_detalhadas SET valor = '99,90', data_emissao = '2026-02-01' "
+                         "WHERE chave = 'x'")
+            self.assertEqual(self._linha(conn, "x")[0], 9990)
+            self.assertEqual(self._linha(conn, "x")[2], "2026-02-01")
+            total = conn.execute("SELECT SUM(valor_centavos) FROM notas_detalhadas "
+                                 "WHERE data_emissao_iso BETWEEN '2026-02-01' AND '2026-02-28'").fetchone()[0]
+            self.assertEqual(total, 9990)
+
+    def test_backfill_de_banco_existente(self):
+        conn = sqlite3.connect(str(self.db_path))
+        conn.execute("CREATE TABLE notas_detalhadas (chave TEXT PRIMARY KEY, valor TEXT, "
+                     "data_emissao TEXT, informante TEXT)")
+        conn.execute("INSERT INTO notas_detalhadas VALUES ('a', '1.234,56', '2025-12-31T23:59:00-03:00', '1')")
+        conn.commit()
+        conn.close()
+        aplicar_migracoes(self.db_path)
+        with sqlite3.connect(str(self.db_path)) as conn:
+            self.assertEqual(self._linha(conn, "a")[:3], (123456, None, "2025-12-31"))
+
+    def test_formatacao(self):
+        self.assertEqual(formatar_centavos(12345678), "R$ 123.456,78")
+        self.assertEqual(formatar_centavos(None), "")
+        self.assertEqual(iso_para_br("2026-01-05"), "05/01/2026")
+
+
+if __name__ == "__main__":
+    unittest.main()
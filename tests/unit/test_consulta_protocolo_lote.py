@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/consulta_protocolo_lote.py: agrupamento por cUF/modelo,
+limite de concorrência por endpoint e reaproveitamento de respostas recentes.
+
+Uso:
+    python -m unittest tests.unit.test_consulta_protocolo_lote -v
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.consulta_protocolo_lote import (
+    CacheProtocolos, ConsultaProtocoloLote, agrupar_por_uf_modelo,
+)
+
+SVRS = "https://svrs"
+
+
+def _chave(cuf: str, modelo: str, n: int) -> str:
+    return f"{cuf}261047539664000197{modelo}001{n:09d}1{n:08d}"[:44].ljust(44, "0")
+
+
+def _resolver(cuf, modelo):
+    # MG tem endpoint próprio; as demais UFs caem no SVRS
+    return f"https://mg/{modelo}" if cuf == "31" else SVRS
+
+
+class _Servidor:
+    def __init__(self, atraso=0.02, falhar=()):
+        self.atraso = atraso
+        self.falhar = set(falhar)
+        self.ativos = {}
+        self.pico = {}
+        self.chamadas = []
+        self._lock = threading.Lock()
+
+    def consultar(self, url, chave, modelo):
+        with self._lock:
+            self.chamadas.append(chave)
+            self.ativos[url] = self.ativos.get(url, 0) + 1
+            self.pico[url] = max(self.pico.get(url, 0), self.ativos[url])
+        time.sleep(self.atraso)
+        with self._lock:
+            self.ativos[url] -= 1
+        if chave in self.falhar:
+            raise ConnectionError("timeout")
+        return f"<retConsSit><chave>{chave}</chave><modelo>{modelo}</modelo></retConsSit>"
+
+
+class TestConsultaProtocoloLote(unittest.TestCase):
+    def test_agrupa_por_uf_e_modelo_sem_repetir(self):
+        a, b, c = _chave("35", "55", 1), _chave("35", "57", 2), _chave("31", "55", 3)
+        grupos = agrupar_por_uf_modelo([a, b, a, c, "123", _chave("35", "99", 4)])
+        self.assertEqual(grupos, {("35", "55"): [a], ("35", "57"): [b], ("31", "55"): [c]})
+
+    def test_limite_por_endpoint_e_falhas(self):
+        chaves = [_chave(uf, "55", i) for i, uf in enumerate(["35", "43", "31"] * 8)]
+        servidor = _Servidor(falhar={chaves[0]})
+        lote = ConsultaProtocoloLote(servidor.consultar, _resolver, max_por_endpoint=2, max_total=8,
+                                     cache=CacheProtocolos())
+        resultados = {r.chave: r for r in lote.executar(chaves)}
+
+        self.assertEqual(set(resultados), set(chaves))
+        self.assertLessEqual(servidor.pico[SVRS], 2)  # SP e RS dividem o mesmo limite
+        self.assertLessEqual(servidor.pico["https://mg/55"], 2)
+        self.assertIsNone(resultados[chaves[0]].xml)
+        self.assertIn("timeout", resultados[chaves[0]].erro)
+        self.assertIn(chaves[1], resultados[chaves[1]].xml)
+
+    def test_respostas_recentes_nao_sao_consultadas_de_novo(self):
+        chaves = [_chave("35", "57", i) for i in range(3)]
+        servidor = _Servidor(atraso=0, falhar={chaves[2]})
+        cache = CacheProtocolos(ttl=60)
+        lote = ConsultaProtocoloLote(servidor.consultar, _resolver, cache=cache, escopo="A")
+        list(lote.executar(chaves))
+        segunda = {r.chave: r for r in lote.executar(chaves)}
+
+        # Só a que falhou volta ao servidor
+        self.assertEqual(len(servidor.chamadas), 4)
+        self.assertTrue(segunda[chaves[0]].do_cache)
+        self.assertFalse(segunda[chaves[2]].do_cache)
+
+        # Outro escopo (certificado) ou TTL vencido consulta de novo
+        outro = ConsultaProtocoloLote(servidor.consultar, _resolver, cache=cache, escopo="B")
+        list(outro.executar(chaves[:1]))
+        self.assertEqual(len(servidor.chamadas), 5)
+        self.assertIsNone(cache.obter("A", chaves[0], agora=time.monotonic() + 61))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/danfse_prefetch.py: pré-download do DANFSe oficial ao lado
+do XML, registro de pdf_path/pdf_tipo, DANFSe genérico substituído pelo
+oficial e tratamento de 404/429.
+
+Uso:
+    python -m unittest tests.unit.test_danfse_prefetch -v
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.danfse_prefetch import PrefetcherDANFSe
+from modules.database import DatabaseManager
+from modules.nfse_busca_concorrente import ControleAIMD
+from modules.schema_migrations import esquecer_cache
+
+CNPJ = "47539664000197"
+CERT = (CNPJ, "cert.pfx", "senha", CNPJ, "35")
+PDF = b"%PDF-1.4\n" + b"0" * 4096
+
+
+class _RespostaHttp:
+    def __init__(self, status, headers=None):
+        self.status_code = status
+        self.headers = headers or {}
+
+
+class _ErroHttp(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.response = _RespostaHttp(status, headers)
+
+
+class _ServicoFalso:
+    def __init__(self, indisponiveis=(), limitar_uma_vez=()):
+        self.indisponiveis = set(indisponiveis)
+        self.limitar = set(limitar_uma_vez)
+        self.chamadas = []
+        self._lock = threading.Lock()
+
+    def consultar_danfse(self, chave, retry=3, numero=None, cnpj_prestador=None):
+        with self._lock:
+            self.chamadas.append(chave)
+            if chave in self.limitar:
+                self.limitar.discard(chave)
+                raise _ErroHttp(429, {"Retry-After": "0"})
+        if chave in self.indisponiveis:
+            raise _ErroHttp(404)
+        return PDF
+
+
+class TestDanfsePrefetch(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        base = Path(self._tmpdir.name)
+        self.db = DatabaseManager(base / "notas.db")
+        self.chaves = [str(i) * 50 for i in range(1, 5)]
+        self.xmls = {}
+        with self.db._connect() as conn:
+            for i, chave in enumerate(self.chaves):
+                xml = base / "xmls" / CNPJ / "NFSE" / "2026-10" / f"NFSe_{i}.xml"
+                xml.parent.mkdir(parents=True, exist_ok=True)
+                xml.write_text("<NFSe/>", encoding="utf-8")
+                self.xmls[chave] = xml
+                conn.execute(
+                    "INSERT INTO notas_detalhadas (chave, numero, tipo, informante, data_emissao, pdf_path) "
+                    "VALUES (?, ?, 'NFS-e', ?, '2026-10-01', ?)", (chave, str(i), CNPJ, str(xml)))
+            # Nota ABRASF (chave fora do padrão ADN) nunca é pedida ao ADN
+            conn.execute("INSERT INTO notas_detalhadas (chave, tipo, informante, pdf_path) "
+                         "VALUES ('123_000000000000010', 'NFS-e', ?, 'x.xml')", (CNPJ,))
+            conn.commit()
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _pdf_no_banco(self, chave):
+        with self.db._connect() as conn:
+            return conn.execute("SELECT pdf_path, pdf_tipo FROM notas_detalhadas WHERE chave = ?",
+                                (chave,)).fetchone()
+
+    def test_baixa_ao_lado_do_xml_e_registra_oficial(self):
+        servico = _ServicoFalso(indisponiveis={self.chaves[3]}, limitar_uma_vez={self.chaves[0]})
+        prefetcher = PrefetcherDANFSe(self.db, controle=ControleAIMD(inicial=3),
+                                      criar_servico=lambda cert: servico)
+        self.assertEqual(prefetcher.enfileirar_pendentes(CERT), 4)
+        self.assertTrue(prefetcher.aguardar(timeout=10))
+
+        for chave in self.chaves[:3]:
+            pdf = self.xmls[chave].with_suffix(".pdf")
+            self.assertEqual(pdf.read_bytes(), PDF)
+            self.assertEqual(self._pdf_no_banco(chave), (str(pdf.resolve()), "OFICIAL"))
+        # 429 volta para a fila; 404 fica sem PDF oficial
+        self.assertEqual(servico.chamadas.count(self.chaves[0]), 2)
+        self.assertNotEqual(self._pdf_no_banco(self.chaves[3])[1], "OFICIAL")
+
+        # Segunda rodada: só a indisponível seria candidata, e ela é lembrada
+        self.assertEqual(prefetcher.enfileirar_pendentes(CERT), 0)
+
+    def test_danfse_generico_e_substituido_pelo_oficial(self):
+        chave = self.chaves[0]
+        pdf = self.xmls[chave].with_suffix(".pdf")
+        pdf.write_bytes(b"%PDF-1.4 generico" + b" " * 3000)   # pdf_simple, mesmo caminho
+        self.db.atualizar_pdf_path(chave, str(pdf.resolve()), "GENERICO")
+        servico = _ServicoFalso()
+        prefetcher = PrefetcherDANFSe(self.db, controle=ControleAIMD(),
+                                      criar_servico=lambda cert: servico)
+        prefetcher.enfileirar(chave, str(self.xmls[chave]), CERT)
+        self.assertTrue(prefetcher.aguardar(timeout=10))
+
+        self.assertEqual(servico.chamadas, [chave])
+        self.assertEqual(pdf.read_bytes(), PDF)
+        self.assertEqual(self._pdf_no_banco(chave), (str(pdf.resolve()), "OFICIAL"))
+
+    def test_oficial_ja_registrado_nao_chama_api(self):
+        chave = self.chaves[0]
+        pdf = self.xmls[chave].with_suffix(".pdf")
+        pdf.write_bytes(PDF)
+        self.db.atualizar_pdf_path(chave, str(pdf.resolve()), "OFICIAL")
+        servico = _ServicoFalso()
+        prefetcher = PrefetcherDANFSe(self.db, controle=ControleAIMD(),
+                                      criar_servico=lambda cert: servico)
+        prefetcher.enfileirar(chave, str(self.xmls[chave]), CERT)
+        self.assertTrue(prefetcher.aguardar(timeout=10))
+        self.assertEqual(servico.chamadas, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/doc_links.py: vínculos extraídos de CT-e (infNFe,
+complemento), NF-e (refNFe) e eventos de CT-e na NF-e, reprocessamento sem
+vínculos velhos, consultas nos dois sentidos e varredura única dos XMLs já
+baixados.
+
+Uso:
+    python -m unittest tests.unit.test_doc_links -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.doc_links import (
+    IndexadorVinculos, backfill_concluido, ctes_da_nfe, extrair_vinculos, nfes_transportadas,
+    registrar, registrar_dados, relacionados,
+)
+from modules.payload_codec import compactar
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+from modules.xml_indexer import parse_cte, parse_nfe
+
+NFE_A = "35250112345678000199550010000000011000000010"
+NFE_B = "35250112345678000199550010000000021000000020"
+CTE = "35250198765432000188570010000000031000000030"
+CTE_COMP = "35250198765432000188570010000000041000000040"
+NS_NFE = 'xmlns="http://www.portalfiscal.inf.br/nfe"'
+NS_CTE = 'xmlns="http://www.portalfiscal.inf.br/cte"'
+
+
+def cte_xml(chave, nfes, complementa=None):
+    docs = "".join(f"<infNFe><chave>{c}</chave></infNFe>" for c in nfes)
+    comp = f"<infCteComp><chCTe>{complementa}</chCTe></infCteComp>" if complementa else ""
+    return (f'<cteProc {NS_CTE}><CTe><infCte Id="CTe{chave}"><ide><nCT>31</nCT></ide>'
+            f'<infCTeNorm><infDoc>{docs}</infDoc></infCTeNorm>{comp}</infCte></CTe></cteProc>')
+
+
+def nfe_xml(chave, refs=()):
+    nfref = "".join(f"<NFref><refNFe>{r}</refNFe></NFref>" for r in refs)
+    return (f'<nfeProc {NS_NFE}><NFe><infNFe Id="NFe{chave}"><ide><nNF>2</nNF>{nfref}</ide></infNFe>'
+            f'</NFe></nfeProc>')
+
+
+def evento_cte(tp, nfe=NFE_A, cte=CTE):
+    return (f'<procEventoNFe {NS_NFE}><evento><infEvento><chNFe>{nfe}</chNFe><tpEvento>{tp}</tpEvento>'
+            f'<detEvento><descEvento>CT-e Autorizado</descEvento><CTe><chCTe>{cte}</chCTe></CTe>'
+            f'</detEvento></infEvento></evento></procEventoNFe>')
+
+
+class TestExtracao(unittest.TestCase):
+    def test_formatos(self):
+        vinculos = extrair_vinculos(cte_xml(CTE_COMP, [NFE_A], complementa=CTE))
+        self.assertEqual([(v.origem, v.destino, v.relacao) for v in vinculos],
+                         [(CTE_COMP, NFE_A, 'transporta'), (CTE_COMP, CTE, 'complementa')])
+        v, = extrair_vinculos(nfe_xml(NFE_B, [NFE_A, NFE_B]))   # auto-referência ignorada
+        self.assertEqual((v.origem, v.destino, v.relacao, v.fonte), (NFE_B, NFE_A, 'referencia', 'documento'))
+        v, = extrair_vinculos(evento_cte('610600'))
+        self.assertEqual((v.origem, v.destino, v.fonte, v.ativo), (CTE, NFE_A, 'evento', True))
+        self.assertFalse(extrair_vinculos(evento_cte('610601'))[0].ativo)
+        self.assertEqual(extrair_vinculos(evento_cte('210210')), [])
+
+    def test_parsers_do_xml_indexer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cte = Path(tmp) / "cte.xml"
+            cte.write_text(cte_xml(CTE, [NFE_A, NFE_B]), encoding="utf-8")
+            nfe = Path(tmp) / "nfe.xml"
+            nfe.write_text(nfe_xml(NFE_B, [NFE_A]), encoding="utf-8")
+            self.assertEqual([v.destino for v in parse_cte(str(cte))["vinculos"]], [NFE_A, NFE_B])
+            self.assertEqual([v.destino for v in parse_nfe(str(nfe))["vinculos"]], [NFE_A])
+
+
+class TestIndice(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        self.db_path = self.dir / "notas.db"
+        aplicar_migracoes(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+
+    def tearDown(self):
+        self.conn.close()
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def test_reprocessar_e_consultar(self):
+        self.conn.execute("INSERT INTO notas_detalhadas (chave, numero, nome_emitente, data_emissao) "
+                          "VALUES (?, '31', 'Transportadora', '2025-01-11')", (CTE,))
+        registrar(self.conn, extrair_vinculos(cte_xml(CTE, [NFE_A, NFE_B])), origem=CTE)
+        registrar(self.conn, extrair_vinculos(evento_cte('610600', cte=CTE_COMP)))
+        # CT-e reprocessado sem NFE_B: o vínculo velho sai, o do evento fica
+        registrar_dados(self.conn, {'chave': CTE, 'xml_status': 'COMPLETO',
+                                    'vinculos': extrair_vinculos(cte_xml(CTE, [NFE_A]))})
+
+        self.assertEqual(ctes_da_nfe(self.conn, NFE_A), [CTE, CTE_COMP])
+        self.assertEqual(nfes_transportadas(self.conn, [CTE]), {CTE: [NFE_A]})
+        self.assertEqual(set(nfes_transportadas(self.conn)), {CTE, CTE_COMP})
+
+        docs = {d['chave']: d for d in relacionados(self.conn, NFE_A)}
+        self.assertEqual((docs[CTE]['tipo'], docs[CTE]['numero'], docs[CTE]['emitente'], docs[CTE]['sentido']),
+                         ("CTe", "31", "Transportadora", "entrada"))
+        self.assertEqual(docs[CTE_COMP]['numero'], "4")   # sem nota no banco: número da chave
+        self.assertEqual([d['descricao'] for d in relacionados(self.conn, CTE)], ["transportado por este documento"])
+
+        registrar(self.conn, extrair_vinculos(evento_cte('610601', cte=CTE_COMP)))
+        self.assertEqual(ctes_da_nfe(self.conn, NFE_A), [CTE])
+
+    def test_varredura_unica(self):
+        cte = self.dir / "cte.xml"
+        cte.write_text(cte_xml(CTE, [NFE_A]), encoding="utf-8")
+        self.conn.executemany("INSERT INTO xmls_baixados (chave, caminho_arquivo, xml_completo) VALUES (?, ?, ?)", [
+            (CTE, str(cte), None),
+            (NFE_B, '', compactar(nfe_xml(NFE_B, [NFE_A]))),   # payload compactado (BLOB NZ)
+            (NFE_A, str(self.dir / "sumiu.xml"), None),
+        ])
+        ev = self.dir / "evento.xml"
+        ev.write_text(evento_cte('610600', cte=CTE_COMP), encoding="utf-8")
+        self.conn.execute("INSERT INTO eventos (chave, tp_evento, caminho) VALUES (?, '610600', ?)", (NFE_A, str(ev)))
+        self.conn.commit()
+
+        progresso = []
+        stats = IndexadorVinculos(self.db_path, lote=2).executar(lambda f, t, _: progresso.append((f, t)))
+
+        self.assertEqual((stats['documentos'], stats['vinculos'], stats['sem_xml']), (4, 3, 1))
+        self.assertEqual(progresso[-1], (4, 4))
+        self.assertTrue(backfill_concluido(self.conn))
+        self.assertEqual({d['chave'] for d in relacionados(self.conn, NFE_A)}, {CTE, CTE_COMP, NFE_B})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/documento_cache.py: acerto/falta por chave, validade pela
+versão da origem (arquivo solto e ZIP mensal), XML do banco até invalidar,
+limites do LRU e memo de varredura de eventos/vínculos.
+
+Uso:
+    python -m unittest tests.unit.test_documento_cache -v
+"""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.arquivo_mensal import montar_caminho
+from modules.documento_cache import CacheDocumentos, cita_chave, evento_do_arquivo, vinculo_do_arquivo
+
+CHAVE = "35250112345678000199550010000000011000000010"
+NS = 'xmlns="http://www.portalfiscal.inf.br/nfe"'
+
+EVENTO = (f'<procEventoNFe {NS}><evento><infEvento Id="ID110111{CHAVE}01"><tpEvento>110111</tpEvento>'
+          f'<dhEvento>2025-01-10T10:00:00-03:00</dhEvento><detEvento><descEvento>Cancelamento</descEvento>'
+          f'</detEvento></infEvento></evento><retEvento><infEvento><cStat>135</cStat>'
+          f'<xMotivo>Evento registrado</xMotivo></infEvento></retEvento></procEventoNFe>')
+
+
+class TestDocumentos(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        self.cargas = 0
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _carregar(self, texto, origem=None):
+        def carregar():
+            self.cargas += 1
+            return texto, origem
+        return carregar
+
+    def test_arquivo_alterado_recarrega(self):
+        xml = self.dir / "nota.xml"
+        xml.write_text("<nfeProc><nNF>1</nNF></nfeProc>", encoding="utf-8")
+        cache = CacheDocumentos()
+
+        doc = cache.documento(CHAVE, self._carregar(xml.read_text(), str(xml)))
+        self.assertEqual(doc.campo('numero', lambda d: d.arvore.findtext('nNF')), "1")
+        self.assertIs(cache.documento(CHAVE, self._carregar("x")), doc)
+        self.assertEqual(doc.campo('numero', lambda d: self.fail("recalculou")), "1")
+        self.assertEqual(cache.origem(CHAVE), str(xml))
+
+        xml.write_text("<nfeProc><nNF>2</nNF></nfeProc>!", encoding="utf-8")
+        doc2 = cache.documento(CHAVE, self._carregar(xml.read_text(), str(xml)))
+        self.assertIsNot(doc2, doc)
+        self.assertEqual(self.cargas, 2)
+
+        xml.unlink()   # arquivado/movido: a entrada deixa de valer
+        self.assertIsNone(cache.documento(CHAVE, lambda: None))
+        self.assertEqual(cache.estatisticas()['documentos'], 0)
+
+    def test_zip_mensal_e_banco(self):
+        zip_path = self.dir / "2025-01.zip"
+        with zipfile.ZipFile(zip_path, 'w') as zf:
+            zf.writestr(f"NFe/{CHAVE}.xml", "<nfeProc/>")
+        cache = CacheDocumentos()
+        origem = montar_caminho(zip_path, f"NFe/{CHAVE}.xml")
+        cache.documento(CHAVE, self._carregar("<nfeProc/>", origem))
+        cache.documento("B" * 44, self._carregar("<nfeProc/>"))          # xml_completo
+        cache.documento(CHAVE, self._carregar("<nfeProc/>", origem))
+        cache.documento("B" * 44, self._carregar("<nfeProc/>"))
+        self.assertEqual(self.cargas, 2)
+
+        os.utime(zip_path, ns=(0, 0))   # container reescrito
+        cache.documento(CHAVE, self._carregar("<nfeProc/>", origem))
+        cache.invalidar(["B" * 44])
+        cache.documento("B" * 44, self._carregar("<nfeProc/>"))
+        self.assertEqual(self.cargas, 4)
+
+    def test_limites_lru(self):
+        cache = CacheDocumentos(max_bytes=25, max_documentos=3)
+        for c in "ABC":
+            cache.documento(c, self._carregar("x" * 10))
+        self.assertEqual(cache.estatisticas()['documentos'], 2)   # bytes: A saiu
+        cache.documento("B", self._carregar("?"))                 # B vira o mais recente
+        cache.documento("D", self._carregar("x" * 10))
+        self.assertIn("B", cache._docs)
+        self.assertNotIn("C", cache._docs)
+        self.assertIsNone(cache.documento("E", self._carregar("")))   # vazio não entra
+        self.assertEqual(cache.registrar("F", "x" * 100).texto, "x" * 100)
+        self.assertNotIn("F", cache._docs)
+
+
+class TestVarredura(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_evento_memorizado_por_arquivo(self):
+        ev = self.dir / "evento.xml"
+        ev.write_text(EVENTO, encoding="utf-8")
+        outro = self.dir / "outro.xml"
+        outro.write_text(EVENTO.replace(CHAVE, "9" * 44), encoding="utf-8")
+        cache = CacheDocumentos()
+
+        campos = evento_do_arquivo(ev, CHAVE, cache)
+        self.assertEqual((campos['tp_evento'], campos['descricao'], campos['cstat'], campos['xmotivo']),
+                         ("110111", "Cancelamento", "135", "Evento registrado"))
+        self.assertIsNone(evento_do_arquivo(outro, CHAVE, cache))
+        faltas = cache.faltas
+        evento_do_arquivo(ev, CHAVE, cache)
+        evento_do_arquivo(outro, CHAVE, cache)
+        self.assertEqual(cache.faltas, faltas)
+        # O outro arquivo não foi parseado: só as sequências de dígitos foram guardadas
+        self.assertEqual(set(cache._arquivos[str(outro)][1]), {'chaves'})
+
+        sintetico = self.dir / "status.xml"
+        sintetico.write_text(f"<statusSEFAZ><chave>{CHAVE}</chave><cStat>101</cStat>"
+                             "<xMotivo>Cancelada</xMotivo></statusSEFAZ>", encoding="utf-8")
+        self.assertEqual(evento_do_arquivo(sintetico, CHAVE, cache)['tp_evento'], "STATUS")
+
+        ilegivel = self.dir / "quebrado.xml"
+        ilegivel.write_text(f"<evento>{CHAVE}", encoding="utf-8")
+        self.assertIsNone(evento_do_arquivo(ilegivel, CHAVE, cache))
+        self.assertFalse(cita_chave(self.dir / "nao_existe.xml", CHAVE, cache))
+
+    def test_vinculo_cte(self):
+        cte = self.dir / "cte.xml"
+        cte.write_text('<cteProc xmlns="http://www.portalfiscal.inf.br/cte"><CTe><infCte><ide><nCT>77</nCT>'
+                       '<dhEmi>2025-01-11</dhEmi></ide><emit><xNome>Transp</xNome></emit>'
+                       f'<infDoc><infNFe><chave>{CHAVE}</chave></infNFe></infDoc></infCte></CTe>'
+                       f'<protCTe><infProt><chCTe>{"3" * 44}</chCTe></infProt></protCTe></cteProc>',
+                       encoding="utf-8")
+        vinculo = vinculo_do_arquivo(cte, CHAVE, "CTe", CacheDocumentos())
+        self.assertEqual(vinculo, {'chave': "3" * 44, 'numero': "77", 'emitente': "Transp", 'data': "2025-01-11"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/download_resumos.py: pipeline Ciência → download com
+reagendamento, 656 por certificado e agenda INDISPONIVEL com nova tentativa.
+
+Uso:
+    python -m unittest tests.unit.test_download_resumos -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.download_resumos import (
+    AGUARDAR, BACKOFF_INDISPONIVEL, BLOQUEADO, MAX_RETENTATIVAS, OK, ItemResumo,
+    PipelineResumos, concluir, marcar_indisponivel, pendentes,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+CHAVE_A = "35240112345678000199550010000000011000000011"
+CHAVE_B = "35240112345678000199550010000000021000000021"
+CHAVE_C = "35240112345678000199550010000000031000000031"
+
+
+class _Relogio:
+    def __init__(self):
+        self.agora = 1_000.0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return self.agora
+
+    def dormir(self, segundos):
+        with self._lock:
+            self.agora += segundos
+
+
+class TestPipelineResumos(unittest.TestCase):
+    def test_ciencias_em_rajada_e_recheck_crescente(self):
+        relogio = _Relogio()
+        eventos = []
+        liberacao = {CHAVE_A: 1, CHAVE_B: 3}   # tentativa em que o XML aparece
+
+        def ciencia(item):
+            eventos.append(('ciencia', item.chave, relogio()))
+            return True
+
+        def baixar(item):
+            eventos.append(('baixar', item.chave, relogio()))
+            liberacao[item.chave] -= 1
+            return OK if liberacao[item.chave] <= 0 else AGUARDAR
+
+        pipeline = PipelineResumos(ciencia, baixar, esperas=(10, 30, 90), max_paralelos=1,
+                                   relogio=relogio, dormir=relogio.dormir)
+        finais = pipeline.executar([ItemResumo(CHAVE_A, "C1"), ItemResumo(CHAVE_B, "C1")])
+
+        self.assertEqual(finais, {CHAVE_A: OK, CHAVE_B: OK})
+        # As duas Ciências saem antes de qualquer download
+        self.assertEqual([e[0] for e in eventos[:2]], ['ciencia', 'ciencia'])
+        tempos_b = [t for tipo, chave, t in eventos if tipo == 'baixar' and chave == CHAVE_B]
+        self.assertEqual([round(b - a) for a, b in zip(tempos_b, tempos_b[1:])], [30, 90])
+
+    def test_656_encerra_certificado_e_aguardar_esgota(self):
+        relogio = _Relogio()
+        chamadas = []
+
+        def baixar(item):
+            chamadas.append(item.chave)
+            if item.certificado == "C1":
+                return BLOQUEADO
+            return AGUARDAR
+
+        pipeline = PipelineResumos(lambda item: False, baixar, esperas=(0, 5), relogio=relogio,
+                                   dormir=relogio.dormir)
+        finais = pipeline.executar([
+            ItemResumo(CHAVE_A, "C1", precisa_ciencia=False),
+            ItemResumo(CHAVE_B, "C1", precisa_ciencia=False),
+            ItemResumo(CHAVE_C, "C2", precisa_ciencia=False),
+        ])
+        self.assertEqual(finais, {CHAVE_A: BLOQUEADO, CHAVE_B: BLOQUEADO, CHAVE_C: AGUARDAR})
+        self.assertEqual(chamadas.count(CHAVE_B), 0)
+        self.assertEqual(chamadas.count(CHAVE_C), 2)
+
+
+class TestAgendaIndisponivel(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmpdir.name) / "notas.db"
+        aplicar_migracoes(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executemany(
+            "INSERT INTO notas_detalhadas (chave, informante, tipo, xml_status, data_emissao) VALUES (?, ?, ?, ?, ?)",
+            [(CHAVE_A, "1", "NFe", "RESUMO", "2024-01-02"),
+             (CHAVE_B, "1", "NFe", "INDISPONIVEL", "2024-01-01"),
+             (CHAVE_C, "1", "NFe", "COMPLETO", "2024-01-03")])
+
+    def tearDown(self):
+        self.conn.close()
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def test_indisponivel_volta_quando_a_data_vence(self):
+        agora = 1_790_000_000
+        # INDISPONIVEL sem agenda (rejeição definitiva) não entra
+        self.assertEqual([c for c, _ in pendentes(self.conn, agora)], [CHAVE_A])
+
+        proxima = marcar_indisponivel(self.conn, CHAVE_A, "1", "137", agora=agora)
+        self.assertEqual(proxima, agora + BACKOFF_INDISPONIVEL[0])
+        self.assertEqual(self.conn.execute("SELECT xml_status FROM notas_detalhadas WHERE chave=?",
+                                           (CHAVE_A,)).fetchone()[0], "INDISPONIVEL")
+        self.assertEqual(pendentes(self.conn, agora), [])
+        self.assertEqual([c for c, _ in pendentes(self.conn, proxima)], [CHAVE_A])
+
+        for _ in range(MAX_RETENTATIVAS - 2):
+            self.assertIsNotNone(marcar_indisponivel(self.conn, CHAVE_A, "1", agora=agora))
+        self.assertIsNone(marcar_indisponivel(self.conn, CHAVE_A, "1", agora=agora))
+        self.assertEqual(pendentes(self.conn, agora + 10**8), [])
+
+        concluir(self.conn, CHAVE_A)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM resumos_download").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/eventos_index.py: extração (procEvento, retEnvEvento,
+statusSEFAZ sintético), upsert por (chave, tpEvento, nSeqEvento), status
+derivado do índice, filtro de canceladas e varredura única das pastas
+Eventos/ (soltas e no ZIP mensal).
+
+Uso:
+    python -m unittest tests.unit.test_eventos_index -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.arquivo_mensal import montar_caminho
+from modules.eventos_index import (
+    IndexadorEventos, backfill_concluido, cancelada, chaves_canceladas, derivar_status,
+    eventos_da_chave, extrair_eventos, indexar_arquivo, registrar, sql_cancelada,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+CHAVE = "35250112345678000199550010000000011000000010"
+CHAVE_CTE = "35250112345678000199570010000000021000000020"
+INFORMANTE = "12345678000199"
+NS = 'xmlns="http://www.portalfiscal.inf.br/nfe"'
+
+
+def proc_evento(chave, tp, seq=1, cstat="135", desc="Cancelamento", tag="procEventoNFe", campo="chNFe"):
+    return (f'<{tag} {NS}><evento><infEvento><{campo}>{chave}</{campo}><dhEvento>2025-01-10T10:00:00-03:00'
+            f'</dhEvento><tpEvento>{tp}</tpEvento><nSeqEvento>{seq}</nSeqEvento><detEvento>'
+            f'<descEvento>{desc}</descEvento></detEvento></infEvento></evento><retEvento><infEvento>'
+            f'<cStat>{cstat}</cStat><xMotivo>Evento registrado</xMotivo><{campo}>{chave}</{campo}>'
+            f'<nProt>135250000000001</nProt><dhRegEvento>2025-01-10T10:00:05-03:00</dhRegEvento>'
+            f'</infEvento></retEvento></{tag}>')
+
+
+class TestExtracao(unittest.TestCase):
+    def test_formatos(self):
+        ev, = extrair_eventos(proc_evento(CHAVE, "110111"))
+        self.assertEqual((ev.chave, ev.tp_evento, ev.n_seq_evento, ev.c_stat, ev.protocolo, ev.descricao),
+                         (CHAVE, "110111", 1, "135", "135250000000001", "Cancelamento"))
+
+        lote = (f'<retEnvEvento {NS}><cStat>128</cStat>'
+                f'<retEvento><infEvento><cStat>135</cStat><chNFe>{CHAVE}</chNFe><tpEvento>210210</tpEvento>'
+                f'<nSeqEvento>1</nSeqEvento></infEvento></retEvento>'
+                f'<retEvento><infEvento><cStat>573</cStat><chNFe>{"9" * 44}</chNFe><tpEvento>210210</tpEvento>'
+                f'</infEvento></retEvento></retEnvEvento>')
+        self.assertEqual([(e.chave, e.c_stat) for e in extrair_eventos(lote)], [(CHAVE, "135"), ("9" * 44, "573")])
+
+        cte = proc_evento(CHAVE_CTE, "110110", seq=2, tag="procEventoCTe", campo="chCTe")
+        self.assertEqual(extrair_eventos(cte)[0].n_seq_evento, 2)
+
+        status, = extrair_eventos(f"<statusSEFAZ><chave>{CHAVE}</chave><cStat>101</cStat>"
+                                  "<xMotivo>Cancelada</xMotivo><tpEvento>110111</tpEvento></statusSEFAZ>")
+        self.assertEqual((status.tp_evento, status.n_seq_evento, status.descricao),
+                         ("110111", 0, "cStat 101: Cancelada"))
+        self.assertEqual(extrair_eventos(f"<nfeProc {NS}><chNFe>{CHAVE}</chNFe></nfeProc>"), [])
+
+
+class TestIndice(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        self.db_path = self.dir / "notas.db"
+        aplicar_migracoes(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        for chave in (CHAVE, CHAVE_CTE, "1" * 44):
+            self.conn.execute("INSERT INTO notas_detalhadas (chave, status) VALUES (?, 'Autorizado o uso da NF-e')",
+                              (chave,))
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def test_upsert_status_e_filtro(self):
+        registrar(self.conn, extrair_eventos(proc_evento(CHAVE, "110110", desc="Carta de Correcao")), "a.xml")
+        self.assertEqual(derivar_status(self.conn, [CHAVE]), 1)
+        self.assertEqual(derivar_status(self.conn, [CHAVE]), 0)   # já aplicado
+
+        registrar(self.conn, extrair_eventos(proc_evento(CHAVE, "110111", cstat="573")), "b.xml")
+        self.assertFalse(cancelada(self.conn, CHAVE))               # rejeitado não cancela
+        # Reprocessar o mesmo evento atualiza a linha; campo ausente não apaga o caminho
+        registrar(self.conn, extrair_eventos(proc_evento(CHAVE, "110111")), None)
+        registrar(self.conn, extrair_eventos(proc_evento(CHAVE_CTE, "110111", tag="procEventoCTe", campo="chCTe")))
+        self.assertTrue(cancelada(self.conn, CHAVE))
+        self.assertEqual(chaves_canceladas(self.conn), {CHAVE, CHAVE_CTE})
+        self.assertEqual([(e['tp_evento'], e['caminho']) for e in eventos_da_chave(self.conn, CHAVE)],
+                         [("110110", "a.xml"), ("110111", "b.xml")])
+
+        self.assertEqual(derivar_status(self.conn), 2)
+        status = dict(self.conn.execute("SELECT chave, status FROM notas_detalhadas"))
+        self.assertEqual(status[CHAVE], "Cancelamento de NF-e homologado")
+        self.assertEqual(status[CHAVE_CTE], "Cancelamento de CT-e homologado")
+        self.assertEqual(status["1" * 44], "Autorizado o uso da NF-e")
+        filtradas = self.conn.execute(
+            f"SELECT chave FROM notas_detalhadas WHERE {sql_cancelada('notas_detalhadas.chave')}").fetchall()
+        self.assertEqual(len(filtradas), 2)
+
+    def test_varredura_unica(self):
+        eventos = self.dir / "xmls" / INFORMANTE / "2025-01" / "Eventos"
+        eventos.mkdir(parents=True)
+        (eventos / f"{CHAVE}_110111.xml").write_text(proc_evento(CHAVE, "110111"), encoding="utf-8")
+        (eventos / "quebrado.xml").write_text("<procEventoNFe>", encoding="utf-8")
+        (self.dir / "xmls" / INFORMANTE / "2025-01" / "NFe").mkdir()
+        zip_path = self.dir / "xmls" / INFORMANTE / "2024-12.zip"
+        with zipfile.ZipFile(zip_path, "w") as zf:
+            zf.writestr(f"Eventos/{CHAVE_CTE}.xml",
+                        proc_evento(CHAVE_CTE, "110110", tag="procEventoCTe", campo="chCTe"))
+            zf.writestr(f"CTe/{CHAVE_CTE}.xml", "<cteProc/>")
+
+        progresso = []
+        stats = IndexadorEventos(self.db_path, self.dir / "xmls", lote=2).executar(
+            lambda feitos, total, _: progresso.append((feitos, total)))
+
+        self.assertEqual((stats['arquivos'], stats['eventos'], stats['ilegiveis']), (3, 2, 1))
+        self.assertEqual(progresso[-1], (3, 3))
+        self.assertEqual(stats['status_alterados'], 2)
+        self.assertTrue(backfill_concluido(self.conn))
+        ev, = eventos_da_chave(self.conn, CHAVE_CTE)
+        self.assertEqual((ev['caminho'], ev['informante']),
+                         (montar_caminho(zip_path, f"Eventos/{CHAVE_CTE}.xml"), INFORMANTE))
+        self.assertEqual(indexar_arquivo(self.conn, self.dir / "nao_existe.xml"), 0)
+
+    def test_cancelar_nao_marca_concluido(self):
+        job = IndexadorEventos(self.db_path, self.dir)
+        job.cancelar()
+        self.assertTrue(job.executar()['cancelado'])
+        self.assertFalse(backfill_concluido(self.conn))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/exportacao_lote.py: localização em lote (arquivo solto e
+arquivo mensal), layout de subpastas, nomes repetidos, ZIP/pasta, PDF
+gerado a partir do XML em disco e cancelamento.
+
+Uso:
+    python -m unittest tests.unit.test_exportacao_lote -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.arquivo_mensal import montar_caminho
+from modules.exportacao_lote import (
+    DestinoPasta, DestinoZip, ExportadorLote, localizar_em_lote, nome_relativo,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+CHAVE_A = "35250112345678000199550010000000011000000011"
+CHAVE_B = "35250212345678000199550010000000021000000021"
+CHAVE_C = "35250298765432000199550010000000031000000031"
+
+
+class TestExportacaoLote(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        self.db_path = self.dir / "notas.db"
+        aplicar_migracoes(self.db_path)
+
+        solto = self.dir / "xmls" / "2025-01" / f"{CHAVE_A}.xml"
+        solto.parent.mkdir(parents=True)
+        solto.write_bytes(b"<nfeProc>A</nfeProc>")
+        solto.with_suffix('.pdf').write_bytes(b"%PDF-A")
+        container = self.dir / "xmls" / "2025-02.zip"
+        with zipfile.ZipFile(container, 'w') as zf:
+            zf.writestr(f"NFe/{CHAVE_B}.xml", "<nfeProc>B</nfeProc>")
+        arquivado = montar_caminho(container, f"NFe/{CHAVE_B}.xml")
+
+        with sqlite3.connect(self.db_path) as conn:
+            for chave, numero, data in ((CHAVE_A, '1', '2025-01-10'), (CHAVE_B, '1', '15/02/2025'),
+                                        (CHAVE_C, '3', '2025-02-20')):
+                conn.execute("INSERT INTO notas_detalhadas (chave, tipo, numero, nome_emitente, "
+                             "cnpj_emitente, data_emissao) VALUES (?, 'NFe', ?, 'Empresa X', ?, ?)",
+                             (chave, numero, chave[6:20], data))
+            conn.execute("INSERT INTO xmls_caminhos (chave, caminho) VALUES (?, ?)", (CHAVE_A, str(solto)))
+            conn.execute("INSERT INTO xmls_baixados (chave, caminho_arquivo) VALUES (?, ?)", (CHAVE_B, arquivado))
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _docs(self, chaves):
+        with sqlite3.connect(self.db_path) as conn:
+            docs = localizar_em_lote(conn, chaves)
+        return [docs[c] for c in chaves if c in docs]
+
+    def test_localiza_em_lote(self):
+        with sqlite3.connect(self.db_path) as conn:
+            docs = localizar_em_lote(conn, [CHAVE_A, CHAVE_B, CHAVE_C, "0" * 44])
+        self.assertEqual(set(docs), {CHAVE_A, CHAVE_B, CHAVE_C})
+        self.assertTrue(docs[CHAVE_A].pdfs[0].endswith(f"{CHAVE_A}.pdf"))
+        self.assertIn("::NFe/", docs[CHAVE_B].xmls[0])
+        self.assertEqual(docs[CHAVE_C].xmls, [])
+        self.assertEqual(nome_relativo(docs[CHAVE_B], 'mes'), f"2025-02/{CHAVE_B}")
+        self.assertEqual(nome_relativo(docs[CHAVE_A], 'mes_tipo', nome_personalizado=True),
+                         "2025-01/NFe/1_Empresa X")
+
+    def test_exporta_zip_com_layout_e_nomes_repetidos(self):
+        destino = self.dir / "saida.zip"
+        exportador = ExportadorLote(DestinoZip(destino), nome_personalizado=True,
+                                    gerar_pdf_faltante=False, leitores=2)
+        stats = exportador.executar(self._docs([CHAVE_A, CHAVE_B, CHAVE_C]))
+
+        with zipfile.ZipFile(destino) as zf:
+            nomes = sorted(zf.namelist())
+            self.assertEqual(zf.read("1_Empresa X.pdf"), b"%PDF-A")
+        # A e B têm o mesmo número/emitente: o segundo ganha sufixo
+        self.assertEqual(nomes, ["1_Empresa X.pdf", "1_Empresa X.xml", "1_Empresa X_2.xml"])
+        self.assertEqual((stats['exportados'], stats['pulados'], stats['arquivos']), (2, 1, 3))
+        self.assertEqual(len(stats['erros']), 3)  # C sem XML; B e C sem PDF (geração desligada)
+        self.assertFalse(list(self.dir.glob(".*.tmp.zip")))
+
+    def test_exporta_pasta_e_usa_busca_lenta(self):
+        extra = self.dir / "achado" / f"{CHAVE_C}.xml"
+        extra.parent.mkdir()
+        extra.write_bytes(b"<nfeProc>C</nfeProc>")
+        pasta = self.dir / "export"
+        stats = ExportadorLote(DestinoPasta(pasta), exportar_pdf=False, layout='mes',
+                               localizar_xml=lambda chave: extra if chave == CHAVE_C else None
+                               ).executar(self._docs([CHAVE_A, CHAVE_B, CHAVE_C]))
+
+        self.assertEqual(stats['exportados'], 3)
+        self.assertEqual((pasta / "2025-02" / f"{CHAVE_B}.xml").read_bytes(), b"<nfeProc>B</nfeProc>")
+        self.assertEqual((pasta / "2025-02" / f"{CHAVE_C}.xml").read_bytes(), b"<nfeProc>C</nfeProc>")
+        self.assertTrue((pasta / "2025-01" / f"{CHAVE_A}.xml").exists())
+
+    def test_gera_pdf_faltante_a_partir_do_xml_em_disco(self):
+        from modules.pdf_lote import ResultadoPDF
+        vistos, pastas = [], []
+
+        def renderizar(trabalhos, cancelado=None):
+            for t in trabalhos:
+                pastas.append(Path(t.xml_path).parent)
+                vistos.append(Path(t.xml_path).read_bytes())
+                Path(t.out_path).write_bytes(b"%PDF-" + Path(t.xml_path).read_bytes())
+                yield ResultadoPDF(t, True)
+
+        destino = self.dir / "saida.zip"
+        with mock.patch('modules.pdf_lote.renderizar_lote', renderizar):
+            stats = ExportadorLote(DestinoZip(destino), exportar_xml=False, leitores=1).executar(
+                self._docs([CHAVE_A, CHAVE_B]))
+
+        self.assertEqual(vistos, [b"<nfeProc>B</nfeProc>"])   # A já tem PDF
+        with zipfile.ZipFile(destino) as zf:
+            self.assertEqual(zf.read(f"{CHAVE_B}.pdf"), b"%PDF-<nfeProc>B</nfeProc>")
+        self.assertEqual((stats['exportados'], stats['pulados'], stats['erros']), (2, 0, []))
+        self.assertFalse(Path(pastas[0]).exists())             # pasta temporária removida
+
+    def test_cancelamento_descarta_zip(self):
+        destino = self.dir / "saida.zip"
+        exportador = ExportadorLote(DestinoZip(destino), exportar_pdf=False, leitores=1)
+        stats = exportador.executar(self._docs([CHAVE_A, CHAVE_B]),
+                                    progresso=lambda feitos, total: exportador.cancelar())
+
+        self.assertTrue(stats['cancelado'])
+        self.assertFalse(destino.exists())
+        self.assertFalse(list(self.dir.glob(".*.tmp.zip")))
+
+
+if __name__ == "__main__":
+    unittest.main()
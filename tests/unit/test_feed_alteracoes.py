@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Testes do feed de alterações de notas_detalhadas (alteracao_seq + lápides em
+notas_removidas) usado pela interface para carregar só o delta.
+
+Uso:
+    python -m unittest tests.unit.test_feed_alteracoes -v
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.database import DatabaseManager
+from modules.schema_migrations import esquecer_cache
+
+
+class TestFeedAlteracoes(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(Path(self._tmpdir.name) / "notas.db")
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _executar(self, sql, params=()):
+        with self.db._connect() as conn:
+            conn.execute(sql, params)
+            conn.commit()
+
+    def test_delta_contem_apenas_o_que_mudou(self):
+        for chave in ("a", "b", "c"):
+            self._executar("INSERT INTO notas_detalhadas (chave, valor) VALUES (?, '1.00')", (chave,))
+        seq = self.db.ultima_alteracao_seq()
+        self.assertGreater(seq, 0)
+
+        self._executar("UPDATE notas_detalhadas SET status = 'Cancelada' WHERE chave = 'b'")
+        self._executar("INSERT OR REPLACE INTO notas_detalhadas (chave, valor) VALUES ('d', '2.00')")
+        alteradas, removidas, ultimo = self.db.load_alteracoes(seq)
+        self.assertEqual([n["chave"] for n in alteradas], ["b", "d"])
+        self.assertEqual(removidas, [])
+        self.assertGreater(ultimo, seq)
+
+        # Nada novo → delta vazio
+        self.assertEqual(self.db.load_alteracoes(ultimo)[:2], ([], []))
+
+    def test_delete_deixa_lapide_e_reinsercao_remove(self):
+        self._executar("INSERT INTO notas_detalhadas (chave) VALUES ('a')")
+        seq = self.db.ultima_alteracao_seq()
+        self.db.deletar_nota_detalhada("a")
+        alteradas, removidas, seq2 = self.db.load_alteracoes(seq)
+        self.assertEqual((alteradas, removidas), ([], ["a"]))
+
+        self._executar("INSERT INTO notas_detalhadas (chave) VALUES ('a')")
+        alteradas, removidas, _ = self.db.load_alteracoes(seq2)
+        self.assertEqual(([n["chave"] for n in alteradas], removidas), (["a"], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
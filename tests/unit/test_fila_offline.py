@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/fila_offline.py: deduplicação, prioridade, reprodução com
+limite por certificado, cooldown (Adiar) e interrupção por queda de rede.
+
+Uso:
+    python -m unittest tests.unit.test_fila_offline -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.fila_offline import (
+    ESPERA_OFFLINE, MAX_TENTATIVAS, Adiar, ReprodutorFila, Rejeitada, adiar, contar,
+    enfileirar, erro_de_rede, pendentes,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+INF = "12345678000199"
+CHAVE_A = "35240112345678000199550010000000011000000011"
+CHAVE_B = "35240112345678000199550010000000021000000021"
+
+
+class _Relogio:
+    def __init__(self):
+        self.agora = 1_790_000_000.0
+
+    def __call__(self):
+        return self.agora
+
+    def dormir(self, segundos):
+        self.agora += segundos
+
+
+class TestFilaOffline(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmpdir.name) / "notas.db"
+        aplicar_migracoes(self.db_path)
+        self.relogio = _Relogio()
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _enfileirar(self, *args, **kwargs):
+        with sqlite3.connect(self.db_path) as conn:
+            return enfileirar(conn, *args, agora=self.relogio(), **kwargs)
+
+    def _pendentes(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return pendentes(conn, agora=self.relogio())
+
+    def test_deduplica_e_ordena_por_prioridade(self):
+        self.assertTrue(self._enfileirar('status', '', CHAVE_A))
+        self.assertTrue(self._enfileirar('manifestacao', INF, CHAVE_A, {'tipo_evento': '210210'}))
+        self.assertFalse(self._enfileirar('manifestacao', INF, CHAVE_A, {'tipo_evento': '210210'}))
+        # Outro evento para a mesma chave é outro pedido
+        self.assertTrue(self._enfileirar('manifestacao', INF, CHAVE_A, {'tipo_evento': '210200'}))
+
+        itens = self._pendentes()
+        self.assertEqual([i.tipo for i in itens], ['manifestacao', 'manifestacao', 'status'])
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(contar(conn), {'manifestacao': 2, 'status': 1})
+
+    def test_reproducao_respeita_sonda_e_limite_por_certificado(self):
+        self._enfileirar('busca_chave', INF, CHAVE_A)
+        self._enfileirar('busca_chave', INF, CHAVE_B)
+        feitos = []
+        online = [False]
+        reprodutor = ReprodutorFila(self.db_path, {'busca_chave': lambda item: feitos.append(
+            (item.chave, self.relogio()))}, sonda=lambda: online[0], por_minuto=6,
+            relogio=self.relogio, dormir=self.relogio.dormir)
+
+        self.assertEqual(reprodutor.drenar()['executadas'], 0)
+        online[0] = True
+        self.assertEqual(reprodutor.drenar()['executadas'], 2)
+        self.assertEqual([c for c, _ in feitos], [CHAVE_A, CHAVE_B])
+        self.assertGreaterEqual(feitos[1][1] - feitos[0][1], 10)  # 6/min = 1 a cada 10 s
+        self.assertEqual(self._pendentes(), [])
+
+    def test_cooldown_rejeicao_e_queda_de_rede(self):
+        self._enfileirar('manifestacao', INF, CHAVE_A, {'tipo_evento': '210210'})
+        self._enfileirar('busca_chave', INF, CHAVE_A)
+        self._enfileirar('busca_chave', "99999999000199", CHAVE_B)
+
+        def manifestar(item):
+            raise Rejeitada("Rejeicao 596: prazo esgotado")
+
+        def buscar(item):
+            if item.informante == INF:
+                raise Adiar(3900, "656")
+            raise ConnectionError("reset")
+
+        stats = ReprodutorFila(self.db_path, {'manifestacao': manifestar, 'busca_chave': buscar},
+                               relogio=self.relogio, dormir=self.relogio.dormir).drenar()
+        self.assertEqual(stats, {'executadas': 0, 'adiadas': 2, 'descartadas': 1})
+
+        with sqlite3.connect(self.db_path) as conn:
+            linhas = dict(conn.execute(
+                "SELECT informante, proxima_tentativa - ? FROM fila_requisicoes", (int(self.relogio()),)))
+        self.assertGreaterEqual(linhas[INF], 3900 - 60)
+        self.assertGreaterEqual(linhas["99999999000199"], ESPERA_OFFLINE - 60)
+
+    def test_descarta_apos_maximo_de_tentativas(self):
+        self._enfileirar('status', '', CHAVE_A)
+        with sqlite3.connect(self.db_path) as conn:
+            item = pendentes(conn, agora=self.relogio())[0]
+            for _ in range(MAX_TENTATIVAS - 1):
+                self.assertTrue(adiar(conn, item, "erro", agora=self.relogio()))
+            self.assertFalse(adiar(conn, item, "erro", agora=self.relogio()))
+            self.assertEqual(contar(conn), {})
+
+    def test_erro_de_rede(self):
+        self.assertTrue(erro_de_rede(ConnectionError("reset")))
+        self.assertTrue(erro_de_rede(TimeoutError()))
+        self.assertFalse(erro_de_rede(FileNotFoundError("cert.pfx")))
+        self.assertFalse(erro_de_rede(ValueError("xml")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/nfe_itens.py: extração em streaming de det/prod e
+imposto (centavos, IBS/CBS por item), substituição em lote, resumo por NCM
+com filtro de emitente/período e varredura única retomável das notas já
+gravadas.
+
+Uso:
+    python -m unittest tests.unit.test_nfe_itens -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.nfe_itens import (
+    IndexadorItens, ativar, ativo, backfill_concluido, contar_pendentes, extrair_itens, indexar_arquivo,
+    registrar, resumo_por_ncm,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+CHAVE = "35250112345678000199550010000000011000000010"
+CHAVE_B = "35250298765432000188550010000000021000000020"
+EMIT = "12345678000199"
+NS = 'xmlns="http://www.portalfiscal.inf.br/nfe"'
+
+
+def det(n, ncm, cfop, q, v, ibs=None):
+    ibscbs = (f'<IBSCBS><CST>000</CST><gIBSCBS><vBC>{v}</vBC><gIBSUF><vIBSUF>0.10</vIBSUF></gIBSUF>'
+              f'<vIBS>{ibs}</vIBS><gCBS><pCBS>0.9</pCBS><vCBS>0.90</vCBS></gCBS></gIBSCBS></IBSCBS>'
+              if ibs else '')
+    return (f'<det nItem="{n}"><prod><cProd>P{n}</cProd><xProd>Produto {n}</xProd><NCM>{ncm}</NCM>'
+            f'<CFOP>{cfop}</CFOP><uCom>UN</uCom><qCom>{q}</qCom><vUnCom>10.0000000000</vUnCom>'
+            f'<vProd>{v}</vProd></prod><imposto><ICMS><ICMS00><vBC>{v}</vBC><vICMS>1.80</vICMS></ICMS00></ICMS>'
+            f'<ICMSUFDest><vICMSUFDest>9.99</vICMSUFDest></ICMSUFDest>'
+            f'<PIS><PISAliq><vPIS>0.17</vPIS></PISAliq></PIS>{ibscbs}</imposto></det>')
+
+
+def nfe_xml(chave, emit, dh, dets):
+    return (f'<nfeProc {NS}><NFe><infNFe Id="NFe{chave}"><ide><dhEmi>{dh}</dhEmi></ide>'
+            f'<emit><CNPJ>{emit}</CNPJ></emit>{"".join(dets)}<total><ICMSTot><vNF>1</vNF></ICMSTot></total>'
+            f'<transp/></infNFe></NFe></nfeProc>')
+
+
+class TestExtracao(unittest.TestCase):
+    def test_campos_tipados(self):
+        xml = nfe_xml(CHAVE, EMIT, "2025-01-10T10:00:00-03:00",
+                      [det(1, "84713012", "5102", "2.0000", "20.00", ibs="0.20"), det(2, "22030000", "5405", "1", "10.00")])
+        a, b = extrair_itens(xml)
+        self.assertEqual((a.chave, a.n_item, a.emit_cnpj, a.dh_emi, a.ncm, a.cfop, a.q_com, a.v_un_com),
+                         (CHAVE, 1, EMIT, "2025-01-10T10:00:00-03:00", "84713012", "5102", 2.0, 10.0))
+        self.assertEqual((a.v_prod_centavos, a.v_icms_centavos, a.v_pis_centavos, a.v_ipi_centavos),
+                         (2000, 180, 17, None))
+        self.assertEqual((a.v_ibs_centavos, a.v_cbs_centavos), (20, 90))
+        self.assertEqual((b.n_item, b.v_ibs_centavos), (2, None))
+        self.assertEqual(extrair_itens(f"<NFe {NS}><infNFe Id='NFe123'/></NFe>"), [])   # sem chave válida
+
+
+class TestIndice(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        self.db_path = self.dir / "notas.db"
+        aplicar_migracoes(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+
+    def tearDown(self):
+        self.conn.close()
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def test_registrar_e_resumo(self):
+        self.assertFalse(ativo(self.conn))
+        ativar(self.conn)
+        self.assertTrue(ativo(self.conn))
+
+        xml = self.dir / "a.xml"
+        xml.write_text(nfe_xml(CHAVE, EMIT, "2025-03-31T23:00:00-03:00",
+                               [det(1, "84713012", "5102", "2", "20.00", ibs="0.20"),
+                                det(2, "84713012", "5102", "1", "10.00")]), encoding="utf-8")
+        self.assertEqual(indexar_arquivo(self.conn, xml), 2)
+        self.assertEqual(indexar_arquivo(self.conn, xml), 2)                  # reprocessar substitui
+        self.assertEqual(indexar_arquivo(self.conn, self.dir / "sumiu.xml"), 0)
+        registrar(self.conn, [(CHAVE_B, extrair_itens(nfe_xml(
+            CHAVE_B, "98765432000188", "2025-04-01T08:00:00-03:00", [det(1, "22030000", "5405", "3", "50.00")])))])
+
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM nfe_itens").fetchone()[0], 3)
+        linha, = resumo_por_ncm(self.conn, emit_cnpj=EMIT, inicio="2025-01-01", fim="2025-03-31")
+        self.assertEqual((linha['ncm'], linha['itens'], linha['notas'], linha['quantidade'],
+                          linha['v_prod_centavos'], linha['v_ibs_centavos']), ("84713012", 2, 1, 3.0, 3000, 20))
+        self.assertEqual([l['ncm'] for l in resumo_por_ncm(self.conn)], ["22030000", "84713012"])
+        self.assertEqual(resumo_por_ncm(self.conn, inicio="2025-04-02"), [])
+
+    def test_varredura_retomavel(self):
+        xml = self.dir / "a.xml"
+        xml.write_text(nfe_xml(CHAVE, EMIT, "2025-01-10", [det(1, "84713012", "5102", "1", "10.00")]),
+                       encoding="utf-8")
+        pasta = self.dir / "xmls" / EMIT
+        pasta.mkdir(parents=True)
+        (pasta / f"{CHAVE_B}.xml").write_text(
+            nfe_xml(CHAVE_B, EMIT, "2025-02-10", [det(1, "22030000", "5405", "1", "5.00")]), encoding="utf-8")
+        self.conn.executemany("INSERT INTO notas_detalhadas (chave, tipo, xml_status) VALUES (?, ?, ?)", [
+            (CHAVE, "NFe", "COMPLETO"),
+            (CHAVE_B, "NFe", "COMPLETO"),             # sem caminho no banco: achada pela pasta
+            ("1" * 44, "NFe", "RESUMO"),              # resumo: sem itens a extrair
+            ("2" * 44, "CTe", "COMPLETO"),
+            ("3" * 44, "NFC-e", "COMPLETO"),          # XML sumiu
+        ])
+        self.conn.execute("INSERT INTO xmls_baixados (chave, caminho_arquivo) VALUES (?, ?)", (CHAVE, str(xml)))
+        self.conn.commit()
+        self.assertEqual(contar_pendentes(self.conn), 3)
+
+        job = IndexadorItens(self.db_path, pasta_xmls=self.dir / "xmls", processos=1, lote=1)
+        progresso = []
+
+        def parar_na_primeira(feitos, total, stats):
+            progresso.append((feitos, total))
+            job.cancelar()
+
+        self.assertTrue(job.executar(parar_na_primeira)['cancelado'])
+        self.assertFalse(backfill_concluido(self.conn))
+
+        stats = IndexadorItens(self.db_path, pasta_xmls=self.dir / "xmls", processos=1, lote=1).executar()
+        self.assertEqual((stats['total'], stats['notas'], stats['itens'], stats['nao_encontradas']), (2, 1, 1, 1))
+        self.assertTrue(backfill_concluido(self.conn))
+        self.assertEqual(progresso, [(1, 3)])
+        self.assertEqual({r[0] for r in self.conn.execute("SELECT chave FROM nfe_itens")}, {CHAVE, CHAVE_B})
+
+
+if __name__ == "__main__":
+    unittest.main()
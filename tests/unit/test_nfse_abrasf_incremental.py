@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/nfse_abrasf_incremental.py: janelas a partir do watermark,
+prefixo contíguo de janelas consultadas e descarte de notas já vistas.
+
+Uso:
+    python -m unittest tests.unit.test_nfse_abrasf_incremental -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.nfse_abrasf_incremental import (
+    consultar_janelas, gravar_watermark, janelas_consulta, ler_watermark,
+    numeros_conhecidos, registrar_vistas,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+HOJE = date(2026, 10, 19)
+
+
+class TestNfseAbrasfIncremental(unittest.TestCase):
+    def test_janelas_carga_inicial_e_incremental(self):
+        janelas = janelas_consulta(None, hoje=HOJE, dias_carga_inicial=40, dias_por_janela=15)
+        self.assertEqual(janelas[0][0], date(2026, 9, 9))
+        self.assertEqual(janelas[-1][1], HOJE)
+        self.assertEqual(len(janelas), 3)
+        for (_, fim), (ini, _) in zip(janelas, janelas[1:]):
+            self.assertEqual((ini - fim).days, 1)
+
+        # Com watermark: só a sobreposição até hoje, uma janela
+        self.assertEqual(janelas_consulta(date(2026, 10, 18), hoje=HOJE, sobreposicao_dias=2),
+                         [(date(2026, 10, 16), HOJE)])
+
+    def test_watermark_so_avanca_no_prefixo_sem_erro(self):
+        janelas = janelas_consulta(None, hoje=HOJE, dias_carga_inicial=44, dias_por_janela=15)
+        falha = janelas[1][0].strftime('%d/%m/%Y')
+
+        def buscar(ini, fim):
+            if ini == falha:
+                return {"status": "erro", "mensagem": "timeout"}
+            return {"status": "sucesso", "notas": [{"numero": ini}]}
+
+        notas, coberto_ate, erros = consultar_janelas(buscar, janelas)
+        self.assertEqual(coberto_ate, janelas[0][1])
+        self.assertEqual(len(erros), 1)
+        self.assertEqual(len(notas), 2)
+
+    def test_notas_vistas_e_watermark_persistem(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "notas.db"
+            aplicar_migracoes(db_path)
+            try:
+                with sqlite3.connect(str(db_path)) as conn:
+                    registrar_vistas(conn, "3550308", "47539664000197", ["10", "11"])
+                    gravar_watermark(conn, "47539664000197", "GINFES", "3550308", HOJE)
+                    self.assertEqual(numeros_conhecidos(conn, "3550308", "47539664000197",
+                                                        ["10", "11", "12"]), {"10", "11"})
+                    self.assertEqual(numeros_conhecidos(conn, "3304557", "47539664000197", ["10"]), set())
+                    self.assertEqual(ler_watermark(conn, "47539664000197", "GINFES", "3550308"), HOJE)
+                    self.assertIsNone(ler_watermark(conn, "47539664000197", "ISSNET", "3550308"))
+            finally:
+                esquecer_cache()
+
+
+if __name__ == "__main__":
+    unittest.main()
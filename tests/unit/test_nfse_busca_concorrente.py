@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/nfse_busca_concorrente.py: janela de lotes em voo contra um
+ADN simulado, tratamento de 429 (AIMD + Retry-After) e watermark contíguo.
+
+Uso:
+    python -m unittest tests.unit.test_nfse_busca_concorrente -v
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.nfse_busca_concorrente import (
+    BLOQUEADO, DOCUMENTOS, LIMITADO, VAZIO, BuscaNSUConcorrente, ControleAIMD,
+    RespostaNSU, interpretar_retry_after,
+)
+
+
+class AdnSimulado:
+    """Devolve lotes de até 50 documentos com NSU > ponto consultado."""
+
+    def __init__(self, total, limitar=(), falhar=(), bloquear=()):
+        self.nsus = list(range(1, total + 1))
+        self.limitar = set(limitar)   # pontos que devolvem 429 na primeira vez
+        self.falhar = set(falhar)     # pontos que sempre lançam exceção
+        self.bloquear = set(bloquear)
+        self.consultas = []
+        self._lock = threading.Lock()
+
+    def __call__(self, ponto):
+        with self._lock:
+            self.consultas.append(ponto)
+            if ponto in self.limitar:
+                self.limitar.discard(ponto)
+                return RespostaNSU(LIMITADO, retry_after=0.05)
+        if ponto in self.falhar:
+            raise ConnectionError("timeout simulado")
+        if ponto in self.bloquear:
+            return RespostaNSU(BLOQUEADO)
+        lote = [n for n in self.nsus if n > ponto][:50]
+        if not lote:
+            return RespostaNSU(VAZIO)
+        return RespostaNSU(DOCUMENTOS, documentos=[(n, f"<Nfse>{n}</Nfse>", "NFS-e") for n in lote])
+
+
+class TestBuscaNSUConcorrente(unittest.TestCase):
+    def _executar(self, adn, watermark=0, **kwargs):
+        recebidos, avancos = [], []
+        busca = BuscaNSUConcorrente(adn, ao_receber=lambda n, x, t: recebidos.append(n),
+                                    ao_avancar=avancos.append, **kwargs)
+        return busca, busca.executar(watermark), recebidos, avancos
+
+    def test_drena_fila_inteira_sem_limite_de_documentos(self):
+        adn = AdnSimulado(1234)
+        busca, resultado, recebidos, avancos = self._executar(adn)
+        self.assertTrue(resultado.chegou_ao_fim)
+        self.assertEqual(resultado.watermark, 1234)
+        self.assertEqual(sorted(recebidos), list(range(1, 1235)))
+        self.assertEqual(avancos, sorted(avancos))
+        self.assertEqual(avancos[-1], 1234)
+        # Não pede muito além do fim
+        self.assertLess(resultado.requisicoes, 1234 // 50 + 10)
+
+    def test_429_reduz_janela_e_repete_o_ponto(self):
+        adn = AdnSimulado(300, limitar={100, 150})
+        controle = ControleAIMD(inicial=4, maximo=4)
+        busca, resultado, recebidos, _ = self._executar(adn, controle=controle)
+        self.assertTrue(resultado.chegou_ao_fim)
+        self.assertEqual(sorted(recebidos), list(range(1, 301)))
+        self.assertGreaterEqual(resultado.limitadas, 1)
+        # 429 não é "NSU inexistente": o ponto foi consultado de novo
+        self.assertGreaterEqual(adn.consultas.count(100), 2)
+
+    def test_erro_persistente_preserva_watermark_contiguo(self):
+        adn = AdnSimulado(300, falhar={100})
+        busca, resultado, recebidos, _ = self._executar(adn, max_tentativas_erro=2)
+        self.assertFalse(resultado.chegou_ao_fim)
+        self.assertIsNotNone(resultado.erro)
+        self.assertEqual(resultado.watermark, 100)
+
+    def test_bloqueio_656_interrompe(self):
+        adn = AdnSimulado(300, bloquear={50})
+        _, resultado, _, _ = self._executar(adn)
+        self.assertTrue(resultado.bloqueado)
+        self.assertLessEqual(resultado.watermark, 50)
+
+    def test_controle_aimd_e_retry_after(self):
+        controle = ControleAIMD(inicial=4, maximo=8)
+        controle.limitado(None, agora=100.0)
+        self.assertEqual(controle.limite, 2)
+        controle.limitado(None, agora=100.5)  # mesma rajada: não reduz de novo
+        self.assertEqual(controle.limite, 2)
+        for _ in range(10):
+            controle.sucesso()
+        self.assertGreater(controle.limite, 2)
+
+        self.assertEqual(interpretar_retry_after("30"), 30.0)
+        self.assertIsNone(interpretar_retry_after(""))
+        agora = datetime(2026, 10, 21, 7, 27, 0, tzinfo=timezone.utc)
+        self.assertEqual(interpretar_retry_after("Wed, 21 Oct 2026 07:28:00 GMT", agora=agora), 60.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
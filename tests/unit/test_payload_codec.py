@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/payload_codec.py: compactação de xml_completo/detalhes_json
+como BLOB, leitura transparente de TEXT legado e migração única.
+
+Uso:
+    python -m unittest tests.unit.test_payload_codec -v
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.payload_codec import (
+    compactar, descompactar, is_compactado, migrar_payloads, relatorio_tamanho,
+)
+
+XML_NFE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+    '<NFe xmlns="http://www.portalfiscal.inf.br/nfe"><infNFe versao="4.00" Id="NFe'
+    + "5" * 44 + '"><ide><cUF>52</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie>'
+    '<nNF>123</nNF><dhEmi>2026-01-05T10:00:00-03:00</dhEmi></ide>'
+    + "".join(f'<det nItem="{i}"><prod><cProd>{i}</cProd><xProd>ITEM Ç {i}</xProd>'
+              f'<NCM>84713012</NCM><CFOP>5102</CFOP></prod></det>' for i in range(1, 20))
+    + '</infNFe></NFe></nfeProc>'
+)
+
+
+class TestCodec(unittest.TestCase):
+    def test_ida_e_volta(self):
+        blob = compactar(XML_NFE)
+        self.assertTrue(is_compactado(blob))
+        self.assertEqual(descompactar(blob), XML_NFE)
+
+    def test_compacta_bem_documento_pequeno(self):
+        self.assertLess(len(compactar(XML_NFE)) * 4, len(XML_NFE.encode("utf-8")))
+
+    def test_texto_legado_passa_direto(self):
+        self.assertEqual(descompactar(XML_NFE), XML_NFE)
+        self.assertEqual(descompactar(XML_NFE.encode("utf-8")), XML_NFE)
+        self.assertIsNone(descompactar(None))
+
+    def test_vazio_vira_none_e_idempotente(self):
+        self.assertIsNone(compactar(""))
+        self.assertIsNone(compactar(None))
+        blob = compactar(XML_NFE)
+        self.assertEqual(compactar(blob), blob)
+
+
+class TestMigracao(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmpdir.name) / "notas.db"
+        conn = sqlite3.connect(str(self.db_path))
+        conn.executescript("""
+            CREATE TABLE xmls_baixados (chave TEXT PRIMARY KEY, cnpj_cpf TEXT,
+                caminho_arquivo TEXT, xml_completo TEXT, baixado_em TEXT);
+            CREATE TABLE historico_nsu (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                informante TEXT, detalhes_json TEXT);
+        """)
+        for i in range(30):
+            conn.execute("INSERT INTO xmls_baixados (chave, xml_completo) VALUES (?, ?)",
+                         (f"{i:044d}", XML_NFE))
+            conn.execute("INSERT INTO historico_nsu (informante, detalhes_json) VALUES (?, ?)",
+                         ("123", json.dumps([{"tipo": "nfe", "chave": f"{i:044d}"}])))
+        conn.execute("INSERT INTO xmls_baixados (chave, caminho_arquivo) VALUES ('sem_xml', 'a.xml')")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_migra_e_preserva_conteudo(self):
+        resultado = migrar_payloads(self.db_path, lote=7)
+        self.assertEqual(resultado["xmls_baixados.xml_completo"], 30)
+        self.assertEqual(resultado["historico_nsu.detalhes_json"], 30)
+        self.assertLess(resultado["bytes_depois"], resultado["bytes_antes"])
+
+        with sqlite3.connect(str(self.db_path)) as conn:
+            tipos = {r[0] for r in conn.execute("SELECT typeof(xml_completo) FROM xmls_baixados")}
+            self.assertEqual(tipos, {"blob", "null"})
+            for (valor,) in conn.execute("SELECT xml_completo FROM xmls_baixados WHERE xml_completo IS NOT NULL"):
+                self.assertEqual(descompactar(valor), XML_NFE)
+            for (valor,) in conn.execute("SELECT detalhes_json FROM historico_nsu"):
+                self.assertEqual(json.loads(descompactar(valor))[0]["tipo"], "nfe")
+
+        # Reexecução não converte nada de novo
+        self.assertEqual(migrar_payloads(self.db_path)["xmls_baixados.xml_completo"], 0)
+
+    def test_relatorio_tamanho(self):
+        antes = relatorio_tamanho(self.db_path)
+        self.assertEqual(antes["xmls_baixados.xml_completo"]["linhas_texto"], 30)
+        self.assertEqual(antes["xmls_baixados.xml_completo"]["linhas_blob"], 0)
+        migrar_payloads(self.db_path)
+        depois = relatorio_tamanho(self.db_path)
+        self.assertEqual(depois["xmls_baixados.xml_completo"]["linhas_blob"], 30)
+        self.assertLess(depois["xmls_baixados.xml_completo"]["bytes_blob"],
+                        antes["xmls_baixados.xml_completo"]["bytes_texto"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/pdf_combinado.py: concatenação incremental na ordem,
+marcadores por documento, PDF ilegível pulado sem corromper a saída,
+cancelamento sem publicar arquivo parcial e temporário removido.
+
+Uso:
+    python -m unittest tests.unit.test_pdf_combinado -v
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+try:
+    from PyPDF2 import PdfReader, PdfWriter
+except ImportError:  # pragma: no cover
+    PdfReader = PdfWriter = None
+
+from modules.pdf_combinado import DocumentoPDF, EscritorPDFIncremental, combinar_pdfs, pdf_unico
+
+
+@unittest.skipIf(PdfWriter is None, "PyPDF2 não instalado")
+class TestPdfCombinado(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _pdf(self, nome, larguras):
+        """PDF com uma página em branco por largura (a largura identifica a página)."""
+        escritor = PdfWriter()
+        for largura in larguras:
+            escritor.add_blank_page(width=largura, height=842)
+        caminho = self.dir / nome
+        with open(caminho, 'wb') as f:
+            escritor.write(f)
+        return str(caminho)
+
+    def _larguras(self, caminho):
+        return [round(float(p.mediabox.width)) for p in PdfReader(str(caminho)).pages]
+
+    def test_concatena_na_ordem_com_marcadores(self):
+        a = self._pdf("a.pdf", [101, 102])
+        b = self._pdf("b.pdf", [201])
+        c = self._pdf("c.pdf", [301, 302, 303])
+        destino = self.dir / "saida.pdf"
+
+        stats = combinar_pdfs([(b, "Nº 2 — Beta"), (a, "Nº 1 — Alfa"), (c, "Nº 3 — Gama")], destino)
+
+        self.assertEqual((stats['documentos'], stats['paginas'], stats['falhas']), (3, 6, []))
+        self.assertEqual(self._larguras(destino), [201, 101, 102, 301, 302, 303])
+        leitor = PdfReader(str(destino))
+        marcadores = leitor.outline
+        self.assertEqual([m.title for m in marcadores], ["Nº 2 — Beta", "Nº 1 — Alfa", "Nº 3 — Gama"])
+        self.assertEqual([leitor.get_destination_page_number(m) for m in marcadores], [0, 1, 3])
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()),
+                         ["a.pdf", "b.pdf", "c.pdf", "saida.pdf"])
+
+    def test_pdf_ilegivel_e_pulado(self):
+        a = self._pdf("a.pdf", [101])
+        ruim = self.dir / "ruim.pdf"
+        ruim.write_bytes(b"%PDF-1.4\nisto nao e um pdf")
+        destino = self.dir / "saida.pdf"
+
+        stats = combinar_pdfs([(str(ruim), "ruim"), (a, "bom")], destino)
+
+        self.assertEqual(stats['documentos'], 1)
+        self.assertEqual(len(stats['falhas']), 1)
+        self.assertEqual(self._larguras(destino), [101])
+        self.assertEqual([m.title for m in PdfReader(str(destino)).outline], ["bom"])
+
+    def test_cancelado_nao_publica_parcial(self):
+        a = self._pdf("a.pdf", [101])
+        b = self._pdf("b.pdf", [201])
+        destino = self.dir / "saida.pdf"
+        destino.write_bytes(b"anterior")
+        feitos = []
+
+        stats = combinar_pdfs([(a, "Alfa"), (b, "Beta")], destino,
+                              progresso=feitos.append, cancelado=lambda: bool(feitos))
+
+        self.assertTrue(stats['cancelado'])
+        self.assertEqual((stats['documentos'], stats['paginas']), (1, 1))
+        self.assertEqual(destino.read_bytes(), b"anterior")   # arquivo anterior intacto
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["a.pdf", "b.pdf", "saida.pdf"])
+
+    def test_escritor_reverte_documento_que_falha_no_meio(self):
+        a = self._pdf("a.pdf", [101])
+        b = self._pdf("b.pdf", [201])
+        destino = self.dir / "saida.pdf"
+        with EscritorPDFIncremental(destino) as escritor:
+            escritor.acrescentar(a, "A")
+            original = escritor._escrever
+            chamadas = []
+
+            def falhar(idnum, obj):
+                chamadas.append(idnum)
+                if len(chamadas) > 1:
+                    raise IOError("disco cheio")
+                original(idnum, obj)
+
+            escritor._escrever = falhar
+            with self.assertRaises(IOError):
+                escritor.acrescentar(b, "B")
+            escritor._escrever = original
+            escritor.acrescentar(b, "B")
+
+        self.assertEqual(self._larguras(destino), [101, 201])
+
+    def test_pdf_unico_sem_pdf_nem_xml(self):
+        a = self._pdf("a.pdf", [101])
+        destino = self.dir / "saida.pdf"
+        docs = [DocumentoPDF("1" * 44, "Alfa", pdf_path=a),
+                DocumentoPDF("2" * 44, "Sem arquivo", pdf_path=str(self.dir / "nao_existe.pdf"))]
+
+        stats = pdf_unico(docs, destino)
+
+        self.assertEqual(stats['paginas'], 1)
+        self.assertEqual(stats['sem_pdf'], ["2" * 44])
+        self.assertEqual(stats['gerados'], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
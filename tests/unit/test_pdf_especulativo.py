@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/pdf_especulativo.py: prioridade (linhas visíveis antes
+das recentes, rolagem descarta a tela anterior), notas sem PDF possível,
+registro de pdf_path, orçamento de disco conferido com os PDFs que ainda
+existem e espera pelo documento em voo.
+
+Uso:
+    python -m unittest tests.unit.test_pdf_especulativo -v
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules import pdf_especulativo
+from modules.database import DatabaseManager
+from modules.pdf_especulativo import PreRenderizadorPDF, bytes_em_disco
+from modules.pdf_lote import ResultadoPDF
+from modules.schema_migrations import esquecer_cache
+
+CHAVES = {nome: (str(i) * 44) for i, nome in enumerate("ABCDEF", 1)}
+
+
+class TestPdfEspeculativo(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        self.db = DatabaseManager(self.dir / "notas.db")
+        self.renderizados = []
+        self.bloqueio = threading.Event()
+        self.bloqueio.set()
+
+        with self.db._connect() as conn:
+            for nome, chave in CHAVES.items():
+                tipo, status = {'E': ('NFS-e', 'COMPLETO'), 'F': ('NFe', 'EVENTO')}.get(nome, ('NFe', 'COMPLETO'))
+                xml = self.dir / f"{chave}.xml"
+                xml.write_text("<nfeProc/>", encoding="utf-8")
+                conn.execute("INSERT INTO notas_detalhadas (chave, tipo, numero, xml_status) VALUES (?, ?, '1', ?)",
+                             (chave, tipo, status))
+                conn.execute("INSERT INTO xmls_caminhos (chave, caminho) VALUES (?, ?)", (chave, str(xml)))
+        (self.dir / f"{CHAVES['D']}.pdf").write_bytes(b"%PDF existente")
+
+        self.patch = mock.patch.object(pdf_especulativo, 'renderizar', self._renderizar)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _renderizar(self, trabalho):
+        self.bloqueio.wait(5)
+        self.renderizados.append(trabalho.chave)
+        Path(trabalho.out_path).write_bytes(b"%PDF" + b"x" * 1000)
+        return ResultadoPDF(trabalho, True, None, 0.01)
+
+    def _pre(self, **kwargs):
+        pre = PreRenderizadorPDF(self.db, usar_processo=False, **kwargs)
+        self.addCleanup(pre.encerrar)
+        return pre
+
+    def _esperar(self, pre, condicao, timeout=5.0):
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            with pre._cond:
+                ocioso = not pre._fila and pre._em_voo is None
+            if condicao() and ocioso:
+                return
+            time.sleep(0.01)
+        self.fail("pré-renderizador não terminou")
+
+    def test_visiveis_antes_de_recentes_e_rolagem_descarta(self):
+        pre = self._pre()
+        with pre.interativo():   # segura o trabalho enquanto a fila é montada
+            pre.recentes([CHAVES['A']])
+            pre.visiveis([CHAVES['B'], CHAVES['C']])
+            pre.visiveis([CHAVES['C'], CHAVES['D'], CHAVES['E'], CHAVES['F']])
+        self._esperar(pre, lambda: len(self.renderizados) >= 2)
+
+        # B saiu da tela; D já tem PDF; E é NFS-e; F é evento
+        self.assertEqual(self.renderizados, [CHAVES['C'], CHAVES['A']])
+        with self.db._connect() as conn:
+            pdf_path = conn.execute("SELECT pdf_path FROM notas_detalhadas WHERE chave = ?",
+                                    (CHAVES['C'],)).fetchone()[0]
+        self.assertEqual(Path(pdf_path), (self.dir / f"{CHAVES['C']}.pdf").resolve())
+        with self.db._connect() as conn:
+            self.assertEqual(bytes_em_disco(conn), 2 * 1004)
+            (self.dir / f"{CHAVES['A']}.pdf").unlink()           # apagado pelo usuário: deixa de contar
+            self.assertEqual(bytes_em_disco(conn), 1004)
+            self.assertEqual(conn.execute("SELECT chave FROM pdf_especulativo").fetchall(), [(CHAVES['C'],)])
+        self.assertEqual(pre.recentes([CHAVES['C']]), 0)   # já gerado nesta sessão
+
+    def _registrar_pdf_antigo(self, nome, tamanho):
+        antigo = self.dir / nome
+        antigo.write_bytes(b"x" * tamanho)
+        with self.db._connect() as conn:
+            conn.execute("INSERT INTO pdf_especulativo (chave, caminho, bytes) VALUES (?, ?, ?)",
+                         (nome, str(antigo), tamanho))
+        return antigo
+
+    def test_orcamento_de_disco(self):
+        self._registrar_pdf_antigo("antigo.pdf", 2 * 1024 * 1024)
+        pre = self._pre(orcamento_mb=1)
+        pre.visiveis([CHAVES['A'], CHAVES['B']])
+        self._esperar(pre, lambda: pre._esgotado)
+
+        self.assertEqual(self.renderizados, [])
+        self.assertEqual(pre.visiveis([CHAVES['C']]), 0)
+
+    def test_pdf_apagado_libera_orcamento(self):
+        self._registrar_pdf_antigo("antigo.pdf", 2 * 1024 * 1024).unlink()
+        pre = self._pre(orcamento_mb=1)
+        pre.visiveis([CHAVES['A']])
+        self._esperar(pre, lambda: self.renderizados)
+
+        self.assertFalse(pre._esgotado)
+        self.assertEqual(self.renderizados, [CHAVES['A']])
+        self.assertEqual(pre._usados, 1004)
+
+    def test_aguardar_documento_em_voo(self):
+        self.bloqueio.clear()
+        pre = self._pre()
+        pre.visiveis([CHAVES['A']])
+        limite = time.monotonic() + 5
+        while pre._em_voo != CHAVES['A'] and time.monotonic() < limite:
+            time.sleep(0.01)
+        threading.Timer(0.05, self.bloqueio.set).start()
+
+        with pre.interativo():
+            caminho = pre.aguardar(CHAVES['A'], timeout=5)
+        self.assertEqual(Path(caminho), (self.dir / f"{CHAVES['A']}.pdf").resolve())
+        self.assertIsNone(pre.aguardar(CHAVES['B'], timeout=0.1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/pdf_lote.py: detecção do tipo, escrita atômica (sem
+temporários) e lote no pool de processos com falha isolada por documento.
+
+Uso:
+    python -m unittest tests.unit.test_pdf_lote -v
+"""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.pdf_lote import TrabalhoPDF, detectar_tipo, renderizar, renderizar_lote, resumir
+
+NFE = ('<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe><infNFe Id="NFe{n}">'
+       '<ide><mod>55</mod><nNF>{n}</nNF></ide></infNFe></NFe></nfeProc>')
+
+
+class TestPdfLote(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmpdir.name)
+        # Sem geradores instalados, pdf_simple registra o último recurso em ./logs
+        self._cwd = os.getcwd()
+        os.chdir(self.base)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmpdir.cleanup()
+
+    def _xml(self, n: int) -> Path:
+        caminho = self.base / "xmls" / f"{n}.xml"
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        caminho.write_text(NFE.format(n=n), encoding="utf-8")
+        return caminho
+
+    def test_detectar_tipo(self):
+        self.assertEqual(detectar_tipo(NFE.format(n=1)), "NFe")
+        self.assertEqual(detectar_tipo(NFE.format(n=1).replace("<mod>55", "<mod>65")), "NFCe")
+        self.assertEqual(detectar_tipo("<cteProc/>"), "CTe")
+        self.assertEqual(detectar_tipo('<CompNfse xmlns="http://www.abrasf.org.br/nfse.xsd"/>'), "NFS-e")
+        self.assertIsNone(detectar_tipo("<resNFe/>"))
+
+    def test_renderizar_grava_atomicamente(self):
+        xml = self._xml(1)
+        resultado = renderizar(TrabalhoPDF(str(xml), str(xml.with_suffix(".pdf")), "NFe"))
+        self.assertTrue(resultado.ok, resultado.erro)
+        self.assertTrue(xml.with_suffix(".pdf").exists())
+        self.assertEqual(list(xml.parent.glob(".*.tmp.pdf")), [])
+
+        falha = renderizar(TrabalhoPDF(str(self.base / "nao_existe.xml"), str(self.base / "x.pdf")))
+        self.assertFalse(falha.ok)
+        self.assertIn("FileNotFoundError", falha.erro)
+        self.assertFalse((self.base / "x.pdf").exists())
+
+    def test_lote_em_processos(self):
+        trabalhos = [TrabalhoPDF(str(x), str(x.with_suffix(".pdf")), "NFe") for x in map(self._xml, range(1, 6))]
+        trabalhos.append(TrabalhoPDF(str(self.base / "sumiu.xml"), str(self.base / "sumiu.pdf")))
+
+        resultados = list(renderizar_lote(trabalhos, processos=2))
+        self.assertEqual(len(resultados), 6)
+        stats = resumir(resultados, 1.0)
+        self.assertEqual((stats['gerados'], stats['falhas']), (5, 1))
+        self.assertEqual(sorted(p.name for p in (self.base / "xmls").glob("*.pdf")),
+                         [f"{n}.pdf" for n in range(1, 6)])
+
+    def test_cancelamento_para_de_enviar(self):
+        trabalhos = [TrabalhoPDF(str(x), str(x.with_suffix(".pdf")), "NFe") for x in map(self._xml, range(1, 4))]
+        resultados = list(renderizar_lote(trabalhos, processos=1, cancelado=lambda: True))
+        self.assertEqual(resultados, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/relatorios.py: filtros (escopo, tipo), IBS/CBS vindo de
+nfe_docs para notas antigas, totais e agrupamentos no banco, paginação sem
+cursor aberto entre páginas e exportação em fluxo (xlsx/CSV).
+
+Uso:
+    python -m unittest tests.unit.test_relatorios -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+try:
+    import openpyxl
+except ImportError:  # pragma: no cover
+    openpyxl = None
+
+from modules.relatorios import (
+    RELATORIO_IBS_CBS, RELATORIO_NOTAS, FiltroRelatorio, Paginador, exportar_csv, exportar_xlsx,
+    relatorio_agrupado, totais,
+)
+from modules.schema_migrations import aplicar_migracoes, esquecer_cache
+
+EMPRESA = "11111111000111"
+OUTRA = "22222222000122"
+
+NOTAS = [
+    # chave, tipo, numero, data, emitente, destinatario, informante, valor, ibs, cbs
+    ("1" * 44, "NFe", "10", "2025-01-10T10:00:00-03:00", OUTRA, EMPRESA, EMPRESA, "1.000,00", "10,00", "90,00"),
+    ("2" * 44, "NFe", "11", "15/01/2025", OUTRA, EMPRESA, EMPRESA, "500,50", "", ""),
+    ("3" * 44, "CTe", "12", "2025-02-03", OUTRA, EMPRESA, EMPRESA, "200.00", "1.00", "9.00"),
+    ("4" * 44, "NFe", "13", "2025-02-20", EMPRESA, OUTRA, EMPRESA, "300,00", "", ""),
+    ("5" * 44, "NFe", "14", "2024-12-31", OUTRA, EMPRESA, EMPRESA, "999,99", "", ""),
+]
+
+
+class TestRelatorios(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmpdir.name)
+        db_path = self.dir / "notas.db"
+        aplicar_migracoes(db_path)
+        self.conn = sqlite3.connect(db_path)
+        for chave, tipo, numero, data, emit, dest, inf, valor, ibs, cbs in NOTAS:
+            self.conn.execute(
+                "INSERT INTO notas_detalhadas (chave, tipo, numero, data_emissao, cnpj_emitente, "
+                "nome_emitente, cnpj_destinatario, informante, valor, v_ibs, v_cbs, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'Autorizado')",
+                (chave, tipo, numero, data, emit, f"Empresa {emit[:2]}", dest, inf, valor, ibs, cbs))
+        # Nota 2 gravada antes das colunas IBS/CBS: valores só no índice de XML
+        self.conn.execute("INSERT INTO nfe_docs (chave, v_ibs, v_cbs) VALUES (?, '5.05', '45.45')", ("2" * 44,))
+        self.conn.commit()
+        self.filtro = FiltroRelatorio("2025-01-01", "2025-02-28", cnpj=EMPRESA)
+
+    def tearDown(self):
+        self.conn.close()
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def _todas(self, relatorio, filtro, ordem=None):
+        return Paginador(self.conn, relatorio, filtro, ordem).proximas(1000)
+
+    def test_filtro_destinatario_e_fallback_nfe_docs(self):
+        linhas = self._todas(RELATORIO_IBS_CBS, self.filtro, ordem="n.numero")
+        rel = RELATORIO_IBS_CBS
+        self.assertEqual([l[rel.indice("Número")] for l in linhas], ["10", "11", "12"])
+        self.assertEqual([(l[rel.indice("IBS")], l[rel.indice("CBS")]) for l in linhas],
+                         [(1000, 9000), (505, 4545), (100, 900)])
+        self.assertEqual(linhas[1][rel.indice("Data")], "2025-01-15")
+
+        t = totais(self.conn, self.filtro)
+        self.assertEqual((t['documentos'], t['valor'], t['ibs'], t['cbs'], t['sem_ibs_cbs']),
+                         (3, 170050, 1605, 14445, 0))
+
+    def test_escopo_envolvida_e_tipo(self):
+        envolvida = FiltroRelatorio("2025-01-01", "2025-02-28", cnpj=EMPRESA, escopo='envolvida')
+        t = totais(self.conn, envolvida)
+        self.assertEqual((t['documentos'], t['sem_ibs_cbs']), (4, 1))
+
+        so_cte = FiltroRelatorio("2025-01-01", "2025-02-28", tipo="CTE", escopo='envolvida')
+        self.assertEqual([l[RELATORIO_NOTAS.indice("Nº")] for l in self._todas(RELATORIO_NOTAS, so_cte)], ["12"])
+
+    def test_agrupamento_por_mes(self):
+        linhas = self._todas(relatorio_agrupado('mes'), self.filtro)
+        self.assertEqual(linhas, [("2025-01", 2, 150050, 1505, 13545), ("2025-02", 1, 20000, 100, 900)])
+
+    def test_paginador_le_sob_demanda(self):
+        pag = Paginador(self.conn, RELATORIO_IBS_CBS, self.filtro)
+        self.assertEqual(len(pag.proximas(2)), 2)
+        self.assertFalse(pag.esgotado)
+        self.assertEqual(len(pag.proximas(2)), 1)
+        self.assertTrue(pag.esgotado)
+        self.assertEqual(pag.proximas(2), [])
+
+    def test_paginador_nao_segura_lock_entre_paginas(self):
+        pag = Paginador(self.conn, RELATORIO_NOTAS, FiltroRelatorio("2025-01-01", "2025-12-31"))
+        numeros = [l[0] for l in pag.proximas(1)]
+        escritor = sqlite3.connect(self.dir / "notas.db", timeout=0)
+        try:
+            escritor.execute("INSERT INTO config (chave, valor) VALUES ('teste', '1')")
+            escritor.commit()   # cursor pela metade daria "database is locked"
+        finally:
+            escritor.close()
+        while not pag.esgotado:
+            numeros += [l[0] for l in pag.proximas(1)]
+        self.assertEqual(sorted(numeros), ["10", "11", "12", "13"])
+
+    @unittest.skipIf(openpyxl is None, "openpyxl não instalado")
+    def test_exporta_xlsx_com_numeros_e_resumo(self):
+        destino = self.dir / "relatorio.xlsx"
+        n = exportar_xlsx(self.conn, RELATORIO_IBS_CBS, self.filtro, destino,
+                          agrupamentos=('mes', 'tipo'), ordem="n.numero")
+
+        self.assertEqual(n, 3)
+        wb = openpyxl.load_workbook(destino)
+        self.assertEqual(wb.sheetnames, ["Relatório IBS CBS", "Resumo por mês", "Resumo por tipo"])
+        linhas = list(wb["Relatório IBS CBS"].iter_rows(values_only=True))
+        self.assertEqual(linhas[0][:3], ("Data", "Tipo", "Número"))
+        self.assertEqual(linhas[1][0], datetime(2025, 1, 10))
+        self.assertEqual(linhas[1][5:8], (1000.0, 10.0, 90.0))
+        self.assertEqual(list(wb["Resumo por tipo"].iter_rows(values_only=True))[1:],
+                         [("CTe", 1, 200.0, 1.0, 9.0), ("NFe", 2, 1500.5, 15.05, 135.45)])
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["notas.db", "relatorio.xlsx"])
+
+    def test_exporta_csv_e_cancelamento(self):
+        destino = self.dir / "relatorio.csv"
+        n = exportar_csv(self.conn, RELATORIO_IBS_CBS, self.filtro, destino, ordem="n.numero")
+
+        self.assertEqual(n, 3)
+        linhas = destino.read_text(encoding="utf-8-sig").splitlines()
+        self.assertEqual(linhas[0].split(";")[:3], ["Data", "Tipo", "Número"])
+        self.assertEqual(linhas[2].split(";")[5:8], ["500,50", "5,05", "45,45"])
+
+        import modules.relatorios as relatorios
+        original = relatorios.LOTE_EXPORTACAO
+        relatorios.LOTE_EXPORTACAO = 1
+        try:
+            with self.assertRaises(InterruptedError):
+                exportar_csv(self.conn, RELATORIO_IBS_CBS, self.filtro, self.dir / "cancelado.csv",
+                             cancelado=lambda: True)
+        finally:
+            relatorios.LOTE_EXPORTACAO = original
+        self.assertFalse((self.dir / "cancelado.csv").exists())
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["notas.db", "relatorio.csv"])
+
+
+if __name__ == "__main__":
+    unittest.main()
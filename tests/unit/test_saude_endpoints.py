@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/saude_endpoints.py: disjuntor por endpoint, sonda após a
+espera, failover para contingência, SOAP Fault (HTTP 500) tratado como
+resposta do servidor e ordenação por latência.
+
+Uso:
+    python -m unittest tests.unit.test_saude_endpoints -v
+"""
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.saude_endpoints import (
+    ABERTO, ESPERA_INICIAL, FECHADO, LIMIAR_FALHAS, TEMPO_MAXIMO_SONDA, CircuitoAberto, RegistroSaude,
+)
+
+UF = "https://nfe.fazenda.sp.gov.br/ws/nfeconsultaprotocolo4.asmx"
+SVC = "https://www.svc.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx"
+
+
+class _Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+class _Resposta:
+    def __init__(self, status, content=b""):
+        self.status_code = status
+        self.content = content
+
+
+class _ErroHttp(Exception):
+    def __init__(self, status, content=b""):
+        super().__init__(f"HTTP {status}")
+        self.response = _Resposta(status, content)
+
+
+class TestSaudeEndpoints(unittest.TestCase):
+    def setUp(self):
+        self.relogio = _Relogio()
+        self.saude = RegistroSaude(relogio=self.relogio)
+
+    def _estado(self, url):
+        return next(e["estado"] for e in self.saude.resumo() if e["url"] == url.lower())
+
+    def test_disjuntor_abre_sonda_e_fecha(self):
+        for _ in range(LIMIAR_FALHAS):
+            self.saude.registrar_falha(UF + "?wsdl", "timeout")  # WSDL e serviço são o mesmo endpoint
+        self.assertEqual(self._estado(UF), ABERTO)
+        self.assertFalse(self.saude.disponivel(UF))
+
+        self.relogio.agora += ESPERA_INICIAL
+        self.assertTrue(self.saude.permite(UF))    # sonda
+        self.assertFalse(self.saude.permite(UF))   # só uma por vez
+        self.saude.registrar_falha(UF, "timeout")
+        self.assertEqual(self.saude.espera_restante(UF), ESPERA_INICIAL * 2)
+
+        self.relogio.agora += ESPERA_INICIAL * 2
+        self.assertTrue(self.saude.permite(UF))
+        self.saude.registrar_sucesso(UF, 0.3)
+        self.assertEqual(self._estado(UF), FECHADO)
+
+    def test_sonda_perdida_e_liberada(self):
+        for _ in range(LIMIAR_FALHAS):
+            self.saude.registrar_falha(UF, "timeout")
+        self.relogio.agora += ESPERA_INICIAL
+        self.assertTrue(self.saude.permite(UF))    # sonda reservada e nunca registrada
+        self.relogio.agora += TEMPO_MAXIMO_SONDA - 1
+        self.assertFalse(self.saude.permite(UF))
+        self.relogio.agora += 1
+        self.assertTrue(self.saude.permite(UF))
+
+    def test_failover_e_falha_rapida(self):
+        chamadas = []
+
+        def post(url):
+            chamadas.append(url)
+            if url == UF:
+                raise ConnectionError("reset")
+            return "ok"
+
+        for _ in range(LIMIAR_FALHAS):
+            self.assertEqual(self.saude.chamar([UF, SVC], post), "ok")
+        # Disjuntor da UF aberto: o próximo certificado vai direto à contingência
+        chamadas.clear()
+        self.assertEqual(self.saude.chamar([UF, SVC], post), "ok")
+        self.assertEqual(chamadas, [SVC])
+
+        with self.assertRaises(CircuitoAberto):
+            self.saude.chamar([UF], post)
+
+    def test_erro_4xx_nao_conta_como_queda(self):
+        def post(url):
+            raise _ErroHttp(403)
+
+        for _ in range(LIMIAR_FALHAS + 1):
+            with self.assertRaises(_ErroHttp):
+                self.saude.chamar([UF, SVC], post)
+        self.assertTrue(self.saude.disponivel(UF))
+
+    def test_soap_fault_com_http_500_nao_conta_como_queda(self):
+        fault = (b'<?xml version="1.0"?><soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">'
+                 b'<soap:Body><soap:Fault><soap:Code><soap:Value>soap:Sender</soap:Value></soap:Code>'
+                 b'</soap:Fault></soap:Body></soap:Envelope>')
+        chamadas = []
+
+        def post(url):
+            chamadas.append(url)
+            raise _ErroHttp(500, fault)
+
+        for _ in range(LIMIAR_FALHAS + 1):
+            with self.assertRaises(_ErroHttp):
+                self.saude.chamar([UF, SVC], post)
+        self.assertEqual(chamadas, [UF] * (LIMIAR_FALHAS + 1))   # sem failover para a SVC
+        self.assertEqual(self._estado(UF), FECHADO)
+
+        def proxy(url):   # 5xx sem Fault (página de erro do proxy) continua contando
+            raise _ErroHttp(503, b"<html>503 Service Unavailable</html>")
+
+        for _ in range(LIMIAR_FALHAS):
+            with self.assertRaises(_ErroHttp):
+                self.saude.chamar([UF], proxy)
+        self.assertEqual(self._estado(UF), ABERTO)
+
+    def test_endpoint_lento_vai_para_o_fim(self):
+        self.saude.registrar_sucesso(UF, 25.0)
+        self.saude.registrar_sucesso(SVC, 0.5)
+        self.assertEqual(self.saude.ordenar([UF, SVC]), [SVC, UF])
+        for _ in range(6):
+            self.saude.registrar_sucesso(UF, 0.1)
+        self.assertEqual(self.saude.ordenar([UF, SVC]), [UF, SVC])
+
+
+if __name__ == "__main__":
+    unittest.main()
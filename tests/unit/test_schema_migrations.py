@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/schema_migrations.py: criação do esquema em banco novo,
+atualização de banco legado e ausência de DDL depois da migração.
+
+Uso:
+    python -m unittest tests.unit.test_schema_migrations -v
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.database import DatabaseManager
+from modules.schema_migrations import (
+    VERSAO_ESQUEMA, aplicar_migracoes, esquecer_cache, versao_atual,
+)
+
+
+def _colunas(conn, tabela):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({tabela})")}
+
+
+class TestSchemaMigrations(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tmpdir.name) / "notas.db"
+
+    def tearDown(self):
+        esquecer_cache()
+        self._tmpdir.cleanup()
+
+    def test_banco_novo_recebe_esquema_completo(self):
+        self.assertEqual(aplicar_migracoes(self.db_path), VERSAO_ESQUEMA)
+        with sqlite3.connect(str(self.db_path)) as conn:
+            self.assertEqual(versao_atual(conn), VERSAO_ESQUEMA)
+            tabelas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            for tabela in ("certificados", "xmls_baixados", "xmls_caminhos", "nsu", "config",
+                           "notas_detalhadas", "historico_nsu", "nfe_docs", "nfse_docs"):
+                self.assertIn(tabela, tabelas)
+            self.assertTrue({"nsu", "v_ibs", "pdf_path", "nome_destinatario"}
+                            <= _colunas(conn, "notas_detalhadas"))
+
+    def test_banco_legado_ganha_colunas_sem_perder_dados(self):
+        conn = sqlite3.connect(str(self.db_path))
+        conn.executescript("""
+            CREATE TABLE certificados (id INTEGER PRIMARY KEY, cnpj_cpf TEXT, caminho TEXT,
+                senha TEXT, informante TEXT, cUF_autor TEXT);
+            CREATE TABLE notas_detalhadas (chave TEXT PRIMARY KEY, numero TEXT, tipo TEXT,
+                data_emissao TEXT, informante TEXT);
+            INSERT INTO notas_detalhadas VALUES ('123', '10', 'NFe', '2025-01-05', '47539664000197');
+        """)
+        conn.close()
+        aplicar_migracoes(self.db_path)
+        with sqlite3.connect(str(self.db_path)) as conn:
+            self.assertIn("nsu", _colunas(conn, "notas_detalhadas"))
+            self.assertIn("ativo", _colunas(conn, "certificados"))
+            self.assertEqual(conn.execute("SELECT numero FROM notas_detalhadas").fetchone()[0], "10")
+
+    def test_sem_ddl_depois_de_migrado(self):
+        DatabaseManager(self.db_path)
+        # Reabertura em outro "processo" (cache limpo): só lê schema_version
+        esquecer_cache()
+        comandos = []
+        original = sqlite3.connect
+
+        def _connect_espiao(*args, **kwargs):
+            conn = original(*args, **kwargs)
+            conn.set_trace_callback(comandos.append)
+            return conn
+
+        sqlite3.connect = _connect_espiao
+        try:
+            DatabaseManager(self.db_path)
+            self.assertFalse([c for c in comandos if "CREATE" in c or "ALTER" in c or "PRAGMA" in c])
+            comandos.clear()
+            # Dentro do mesmo processo nem abre conexão
+            DatabaseManager(self.db_path)
+            self.assertEqual(comandos, [])
+        finally:
+            sqlite3.connect = original
+
+
+if __name__ == "__main__":
+    unittest.main()
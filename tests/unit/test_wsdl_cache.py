@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de modules/wsdl_cache.py: interface de cache do zeep, semeadura a
+partir do pacote embarcado (manifesto) e revalidação.
+
+Uso:
+    python -m unittest tests.unit.test_wsdl_cache -v
+"""
+from __future__ import annotations
+
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR))
+
+from modules.wsdl_cache import MANIFESTO, CacheDocumentos, revalidar
+
+WSDL = "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx?wsdl"
+XSD = "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/tipos.xsd"
+
+
+class _Relogio:
+    def __init__(self):
+        self.agora = 1_790_000_000.0
+
+    def __call__(self):
+        return self.agora
+
+
+class _Resposta:
+    def __init__(self, conteudo, status=200):
+        self.content = conteudo
+        self.status_code = status
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class _Sessao:
+    def __init__(self, respostas):
+        self.respostas = respostas
+
+    def get(self, url, timeout=None):
+        resposta = self.respostas[url]
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+
+class TestWsdlCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmpdir.name)
+        self.relogio = _Relogio()
+        self.cache = CacheDocumentos(self.base / "cache" / "wsdl.db", relogio=self.relogio)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_interface_zeep_e_persistencia(self):
+        self.assertIsNone(self.cache.get(WSDL))
+        self.cache.add(WSDL, b"<definitions/>")
+        # Outro processo (nova instância sobre o mesmo arquivo) enxerga o documento
+        outro = CacheDocumentos(self.base / "cache" / "wsdl.db")
+        self.assertEqual(outro.get(WSDL), b"<definitions/>")
+
+    def test_exporta_e_semeia_pacote_embarcado(self):
+        self.cache.add(WSDL, b"<definitions/>")
+        self.cache.add(XSD, "<schema/>")
+        pasta = self.base / "Arquivo_wsdl"
+        self.assertEqual(self.cache.exportar(pasta, "2026.10"), 2)
+
+        # Arquivo adulterado não entra no cache
+        manifesto = json.loads((pasta / MANIFESTO).read_text(encoding="utf-8"))
+        (pasta / manifesto["documentos"][XSD]["arquivo"]).write_bytes(b"<alterado/>")
+
+        nova = CacheDocumentos(self.base / "nova.db", relogio=self.relogio)
+        self.assertEqual(nova.semear(pasta), 1)
+        self.assertEqual(nova.get(WSDL), b"<definitions/>")
+        self.assertIsNone(nova.get(XSD))
+        self.assertEqual(nova.semear(pasta), 0)
+
+    def test_revalidacao_atualiza_so_documentos_vencidos(self):
+        self.cache.add(WSDL, b"<v1/>")
+        self.relogio.agora += 3600
+        self.cache.add(XSD, b"<schema/>")
+        self.assertEqual(self.cache.vencidos(max_idade=1800), [WSDL])
+
+        sessao = _Sessao({WSDL: _Resposta(b"<v2/>"), XSD: ConnectionError("offline")})
+        self.assertEqual(revalidar(sessao, self.cache, [WSDL, XSD]), [WSDL])
+        self.assertEqual(self.cache.get(WSDL), b"<v2/>")
+        self.assertEqual(self.cache.get(XSD), b"<schema/>")  # falha de rede mantém o documento
+        self.assertEqual(self.cache.vencidos(max_idade=1800), [])
+
+
+if __name__ == "__main__":
+    unittest.main()